@@ -27,11 +27,12 @@ import os
 import re
 import time
 from datetime import datetime, timedelta
-from http.client import RemoteDisconnected
 from zoneinfo import ZoneInfo
 
 import requests
 
+import http_clients
+
 # ==== Настройки ===============================================================
 
 AMO_DOMAIN = (os.getenv("AMO_DOMAIN") or "igroupkz.amocrm.ru").strip()
@@ -75,35 +76,15 @@ _UA = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
 REQUEST_RETRIES = max(1, int(os.getenv("AMO_REQUEST_RETRIES") or 3))
 RETRY_BACKOFF_SECONDS = float(os.getenv("AMO_RETRY_BACKOFF") or 1.0)
 
-# Повторяем ТОЛЬКО обрыв уже установленного соединения: сервер закрыл сокет, не
-# начав отвечать, — значит запрос не выполнялся, и повтор безопасен. Таймауты и
-# отказ в соединении сюда не входят: это «сервис недоступен», и повтор тут только
-# добавит нагрузки. Такой же разбор причины есть у клиента Oktell
-# (`_oktell_dropped_keepalive` в bot_schedule2.py) — там keep-alive рвёт прокси.
-_DROPPED_CONNECTION_ERRORS = (
-    RemoteDisconnected, ConnectionResetError, ConnectionAbortedError, BrokenPipeError)
-
+# Повторяем ТОЛЬКО обрыв уже установленного соединения; разбор причины общий для
+# всех интеграций (`http_clients.dropped_connection`) — тот же, что у клиента
+# Oktell, где keep-alive рвёт прокси.
+_dropped_connection = http_clients.dropped_connection
 
-def _dropped_connection(exc):
-    """Оборвалось ли соединение уже ПОСЛЕ установки.
-
-    Причину ищем по всей цепочке, а не по тексту сообщения: requests заворачивает
-    urllib3, urllib3 — http.client, и наружу выходит одинаковый на вид
-    `ConnectionError('Connection aborted.', ...)`.
-    """
-    stack = [exc]
-    seen = set()
-    while stack:
-        current = stack.pop()
-        if not isinstance(current, BaseException) or id(current) in seen:
-            continue
-        seen.add(id(current))
-        if isinstance(current, _DROPPED_CONNECTION_ERRORS):
-            return True
-        stack.append(current.__cause__)
-        stack.append(current.__context__)
-        stack.extend(getattr(current, "args", ()) or ())
-    return False
+# amoCRM разрешает 7 запросов в секунду на аккаунт — темп держит общий слой, для
+# всех нитей сразу. Повтор обрыва делает сам клиент (`_request`), поэтому слою
+# своих повторов не даём: иначе попытки перемножились бы.
+AMO_RATE_PER_SECOND = 7
 
 
 def is_configured() -> bool:
@@ -127,7 +108,7 @@ class AmoClient:
         self._start_session()
 
     def _start_session(self):
-        session = requests.Session()
+        session = http_clients.session("amocrm", rate_per_second=AMO_RATE_PER_SECOND, retries=0)
         session.headers.update({
             "User-Agent": _UA,
             "Accept": "application/json, text/javascript, */*; q=0.01",
@@ -43,6 +43,9 @@ import reg_contest
 import front_office_calls
 from database import (
     db,
+    MIN_CONN,
+    MAX_CONN,
+    POOL_ACQUIRE_TIMEOUT_SECONDS,
     SHIFT_BREAK_PLANNING_BUFFER_MINUTES,
     SHIFT_BREAK_MIN_EDGE_MARGIN_MINUTES,
     SHIFT_BREAK_MIN_GAP_MINUTES,
@@ -63,6 +66,7 @@ from database import (
     IT_TICKET_DEFAULT_PROFILE,
     resolve_it_ticket_profile,
     resolve_it_ticket_profile_strict,
+    SHIFT_AUCTION_LOT_PATCH_EVENT_TYPES,
     SHIFT_AUCTION_TEST_EVENT_NOTIFY_CHANNEL,
     PROXY_STATUS_LABELS,
     normalize_proxy_status_value,
@@ -89,6 +93,7 @@ import uuid
 from passlib.hash import pbkdf2_sha256
 from werkzeug.utils import secure_filename
 from google.cloud import storage as gcs_storage
+import shutil
 import tempfile
 from datetime import datetime, timedelta, date as dt_date, timezone
 import time
@@ -127,6 +132,13 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # другие точки входа (скрипты, воркеры), а не только монолит. Подробности и
 # причины — в log_secrets.py.
 import log_secrets
+import export_jobs
+import oktell_gateway
+import pg_pool_metrics
+import http_clients
+import scheduler_pools
+import shift_auction_engine
+import sse_gateway
 
 log_secrets.install()
 
@@ -292,6 +304,12 @@ OKTELL_RECORD_MIN_INTERVAL_MS = _env_int('OKTELL_RECORD_MIN_INTERVAL_MS', 150, m
 # Сколько коммутаций спрашиваем одним SELECT-ом при вычислении путей к записям (cap прокси — 1000 строк).
 OKTELL_RECORD_PATH_BATCH = _env_int('OKTELL_RECORD_PATH_BATCH', 200, minimum=1, maximum=500)
 OKTELL_API_PAGE_SIZE = _env_int('OKTELL_API_PAGE_SIZE', 1000, minimum=1, maximum=1000)
+# Шлюз к прокси: сколько запросов идут в прокси одновременно (остальные ждут в очереди по
+# приоритету), сколько живёт ответ за закрытые сутки и сколько строк всего держит кэш.
+OKTELL_GATEWAY_MAX_CONCURRENCY = _env_int('OKTELL_GATEWAY_MAX_CONCURRENCY', 2, minimum=1, maximum=16)
+OKTELL_GATEWAY_CLOSED_DAY_TTL_SECONDS = _env_int(
+    'OKTELL_GATEWAY_CLOSED_DAY_TTL_SECONDS', 6 * 3600, minimum=0, maximum=7 * 24 * 3600)
+OKTELL_GATEWAY_CACHE_MAX_ROWS = _env_int('OKTELL_GATEWAY_CACHE_MAX_ROWS', 200000, minimum=0, maximum=5000000)
 OKTELL_API_MAX_PAGES = _env_int('OKTELL_API_MAX_PAGES', 500, minimum=1, maximum=5000)
 OKTELL_SYNC_MAX_RANGE_DAYS = _env_int('OKTELL_SYNC_MAX_RANGE_DAYS', 3, minimum=1, maximum=31)
 OKTELL_SYNC_NIGHTLY_HOUR = _env_int('OKTELL_SYNC_NIGHTLY_HOUR', 5, minimum=0, maximum=23)
@@ -317,6 +335,9 @@ OKTELL_RESOURCE_CHUNK_DAYS = _env_int('OKTELL_RESOURCE_CHUNK_DAYS', 7, minimum=1
 # Пользовательские отчёты «Биллинг Oktell» всегда ограничены одним периодом до 31 дня.
 # Это отдельный лимит: OKTELL_RESOURCE_MAX_RANGE_DAYS относится только к синхронизации.
 OKTELL_BILLING_MAX_RANGE_DAYS = 31
+# Построчная выгрузка биллинга фоновой задачей (export_jobs): она качается по суткам с
+# чекпоинтами и нить waitress не держит, поэтому ей разрешён период длиннее отчёта на экране.
+OKTELL_BILLING_EXPORT_JOB_MAX_DAYS = _env_int('OKTELL_BILLING_EXPORT_JOB_MAX_DAYS', 92, minimum=1, maximum=366)
 # Только ночной прогон: импорт пересчитывает все исторические прогнозы (тяжело для внутридневного).
 OKTELL_RESOURCE_NIGHTLY_HOUR = _env_int('OKTELL_RESOURCE_NIGHTLY_HOUR', 5, minimum=0, maximum=23)
 OKTELL_RESOURCE_NIGHTLY_MINUTE = _env_int('OKTELL_RESOURCE_NIGHTLY_MINUTE', 40, minimum=0, maximum=59)
@@ -374,7 +395,44 @@ dp = Dispatcher(bot=bot, storage=storage)
 # === Блокировки ==================================================================================================
 report_lock = threading.Lock()
 recruiting_parse_lock = threading.Lock()
-executor_pool = ThreadPoolExecutor(max_workers=4)
+# Джобы планировщика — в своих пулах по классам (см. scheduler_pools.py). executor_pool
+# остаётся общей точкой входа: шаги джобы уходят в пул её класса, а бот, Flask и ручные
+# запуски синков — в прежний пул на четыре места, и ночной синк его больше не занимает.
+SCHEDULER_JOB_POOLS = {
+    'default': 2,
+    'oktell': 2,
+    'chat2desk': 1,
+    'integrations': 2,
+    'broadcast': 2,
+    'maintenance': 1,
+}
+# (шаблон id джобы, пул, внешняя система) — первый подходящий. Система нужна, когда в неё
+# ходят джобы разных пулов: синк метрик Chat2Desk и отбивка чатов делят одну квоту.
+SCHEDULER_JOB_CLASSES = (
+    ('oktell_*', 'oktell', 'oktell'),
+    ('chat2desk_*', 'chat2desk', 'chat2desk'),
+    ('szov_chat_wallboard_broadcast_*', 'broadcast', 'chat2desk'),
+    ('chat_hourly_broadcast', 'broadcast', 'chat2desk'),
+    ('szov_wallboard_broadcast_*', 'broadcast', None),
+    ('amo_leads_broadcast_*', 'broadcast', 'amocrm'),
+    ('front_office_calls_broadcast', 'broadcast', 'crm'),
+    ('*_report', 'broadcast', None),
+    ('tez_*', 'integrations', 'binotel'),
+    ('amo_leads_sync', 'integrations', 'amocrm'),
+    ('reg_contest_*', 'integrations', 'crm'),
+    ('chatapp_sync_daily', 'integrations', 'chatapp'),
+    ('recruiting_*', 'integrations', None),
+    ('*_retention_daily', 'maintenance', None),
+    ('purge_*', 'maintenance', None),
+    ('wazzup_episodes_daily', 'maintenance', None),
+    ('ai_qa_*', 'maintenance', None),
+)
+SCHEDULER_SYSTEM_BUDGETS = {'oktell': 2, 'chat2desk': 1, 'binotel': 1, 'amocrm': 1, 'crm': 1}
+scheduler_job_pools = scheduler_pools.SchedulerPools(
+    SCHEDULER_JOB_POOLS, SCHEDULER_JOB_CLASSES, SCHEDULER_SYSTEM_BUDGETS,
+    journal=db.record_scheduler_job_run)
+executor_pool = scheduler_pools.JobAwareExecutor(
+    scheduler_job_pools, ThreadPoolExecutor(max_workers=4, thread_name_prefix='executor'))
 # Раздел «Обращения» держит свой пул: приём ответа из группы — это запись в три
 # таблицы, и вставать в очередь за отчётами и выгрузками общего пула ей незачем
 # (сотрудник в чате ждёт расписку сразу).
@@ -421,7 +479,7 @@ RECRUITING_RUNTIME_MAX_JOBS = 20
 app = Flask(__name__)
 
 
-def _append_server_timing(name, duration_ms):
+def _append_server_timing(name, duration_ms, description=None):
     metric_name = re.sub(r'[^A-Za-z0-9_-]+', '-', str(name or '').strip()).strip('-')
     if not metric_name:
         return
@@ -433,13 +491,46 @@ def _append_server_timing(name, duration_ms):
     if timings is None:
         timings = []
         g.server_timings = timings
-    timings.append((metric_name, duration))
+    desc = re.sub(r'["\\\r\n]+', ' ', str(description)).strip() if description else None
+    timings.append((metric_name, duration, desc))
 
 
 def _record_elapsed_server_timing(name, started_at):
     _append_server_timing(name, (time.perf_counter() - started_at) * 1000)
 
 
+def _append_db_pool_server_timing():
+    # Ожидание слота и удержание соединений за весь запрос — в Server-Timing,
+    # рядом с остальными замерами: в DevTools сразу видно, ждал ли запрос пул.
+    trace = pg_pool_metrics.request_trace()
+    if not trace or not trace['checkouts']:
+        return
+    _append_server_timing('db-wait', trace['wait_ms'], f"{trace['checkouts']} checkouts")
+    _append_server_timing('db-hold', trace['hold_ms'], f"{trace['queries']} queries")
+
+
+@app.before_request
+def start_db_pool_accounting():
+    # Первым из before_request: авторизация уже ходит в базу, и её выдачи
+    # тоже должны попасть в счёт маршрута. Метка — endpoint, а не путь:
+    # путь с id плодил бы по потребителю на каждую запись.
+    endpoint = request.endpoint or 'unmatched'
+    g._db_pool_tokens = pg_pool_metrics.set_request_consumer(f"route:{endpoint}")
+
+
+@app.teardown_request
+def finish_db_pool_accounting(_exc):
+    tokens = g.pop('_db_pool_tokens', None)
+    if tokens is None:
+        return
+    try:
+        pg_pool_metrics.end_request(tokens)
+    except ValueError:
+        # Токен из другого контекста (стрим закрылся не в той нити) — метка
+        # умрёт вместе с контекстом, учёту это не мешает.
+        pass
+
+
 @app.after_request
 def debug_401_responses(response):
     if response.status_code == 401:
@@ -562,10 +653,20 @@ SHIFT_AUCTION_EVENT_LISTENER_RETRY_SECONDS = 2
 # (which saturated the connection pool during a live auction) into O(events).
 SHIFT_AUCTION_EVENT_BUFFER_MAXLEN = _env_int('SHIFT_AUCTION_EVENT_BUFFER_MAXLEN', 2000, minimum=200)
 SHIFT_AUCTION_EVENT_FETCH_LIMIT = 500
+# Event ids come from a sequence at INSERT time, but claims for different
+# operators commit concurrently, so id 11 may become visible before id 10.
+# Every process runs its own listener; to give all of them the same stream the
+# buffer only advances over a gap once the missing id can no longer commit
+# (see _settle_shift_auction_event_gap). While a gap is open the listener
+# re-checks it this often instead of waiting for the next NOTIFY.
+SHIFT_AUCTION_EVENT_GAP_POLL_SECONDS = 0.2
 shift_auction_event_condition = threading.Condition()
 shift_auction_event_signal_id = 0
 shift_auction_event_buffer = collections.deque(maxlen=SHIFT_AUCTION_EVENT_BUFFER_MAXLEN)
 shift_auction_event_buffer_max_id = 0
+# Open id gap in front of the buffer head:
+# {'missing', 'upto', 'horizon', 'since', 'settled'} — see _settle_shift_auction_event_gap.
+shift_auction_event_gap = None
 shift_auction_event_buffer_ready = False
 shift_auction_event_listener_started = False
 shift_auction_event_listener_lock = threading.Lock()
@@ -708,6 +809,69 @@ def _read_shift_auction_events_from_buffer(after_id):
     return events, covered, signal_id, min_buffered_id
 
 
+def _settle_shift_auction_event_gap(cursor, missing_id, upto_id):
+    """Advance the open-gap state; True once it has just become settled.
+
+    The gap is keyed by its first missing id. Its xmax horizon and ``upto`` (the
+    newest id seen at that moment) are recorded once, when ``missing_id`` is
+    first found missing, and are NOT moved by newer ids arriving behind it —
+    otherwise a steady stream of claims would push the horizon forward forever
+    and the feed would freeze exactly during the rush.
+
+    A gap is settled when every transaction that was running when it was first
+    seen has finished (snapshot xmin reached the recorded xmax): every missing
+    id up to ``upto`` was allocated before that, so it is either committed —
+    and the caller's refetch will see it — or rolled back for good. The short
+    minimum age covers the instant between ``nextval`` and the row write, when
+    the inserting transaction has no xid yet.
+    """
+    global shift_auction_event_gap
+    gap = shift_auction_event_gap
+    cursor.execute(
+        "SELECT txid_snapshot_xmin(txid_current_snapshot()), "
+        "txid_snapshot_xmax(txid_current_snapshot())"
+    )
+    xmin, xmax = cursor.fetchone()
+    if gap is None or gap['settled'] or gap['missing'] != missing_id:
+        shift_auction_event_gap = {
+            'missing': int(missing_id),
+            'upto': int(upto_id),
+            'horizon': int(xmax),
+            'since': time.monotonic(),
+            'settled': False,
+        }
+        return False
+    if (int(xmin) >= gap['horizon']
+            and time.monotonic() - gap['since'] >= SHIFT_AUCTION_EVENT_GAP_POLL_SECONDS):
+        gap['settled'] = True
+        return True
+    return False
+
+
+def _contiguous_shift_auction_events(cursor, batch):
+    """The prefix of ``batch`` that can be published without skipping a pending id.
+
+    Missing ids covered by a settled gap are passed over; any other missing id
+    stops the prefix, and the events behind it wait for the next drain.
+    """
+    global shift_auction_event_gap
+    gap = shift_auction_event_gap
+    if gap is not None and shift_auction_event_buffer_max_id >= gap['upto']:
+        shift_auction_event_gap = gap = None
+    # A new process starts from whatever the recent window begins with.
+    expected = shift_auction_event_buffer_max_id + 1 if shift_auction_event_buffer_max_id else None
+    ready = []
+    for event in batch:
+        event_id = int(event.get("id") or 0)
+        if (expected is not None and event_id > expected
+                and not (gap is not None and gap['settled'] and event_id <= gap['upto'] + 1)):
+            _settle_shift_auction_event_gap(cursor, expected, int(batch[-1].get("id") or 0))
+            break
+        ready.append(event)
+        expected = event_id + 1
+    return ready
+
+
 def _drain_shift_auction_events(cursor):
     """Fetch and broadcast ALL events after the buffer head, paging to exhaustion.
 
@@ -716,20 +880,48 @@ def _drain_shift_auction_events(cursor):
     until a short page guarantees a large backlog — a reconnect after an outage,
     or a burst of more than ``SHIFT_AUCTION_EVENT_FETCH_LIMIT`` NOTIFYs — is fully
     drained instead of stranding the tail until the next live event arrives.
+
+    The head never moves past an id that may still commit (see
+    ``_contiguous_shift_auction_events``). A gap that has just settled is
+    refetched at once, so a late commit is published in order.
     """
+    global shift_auction_event_gap
     while True:
         batch = _fetch_shift_auction_events_with_cursor(cursor, shift_auction_event_buffer_max_id)
         if not batch:
             break
-        _publish_shift_auction_events(batch)
+        ready = _contiguous_shift_auction_events(cursor, batch)
+        _publish_shift_auction_events(ready)
+        gap = shift_auction_event_gap
+        if gap is not None and shift_auction_event_buffer_max_id >= gap['upto']:
+            shift_auction_event_gap = None
+        if len(ready) < len(batch):
+            if shift_auction_event_gap is not None and shift_auction_event_gap['settled']:
+                continue
+            break
         if len(batch) < SHIFT_AUCTION_EVENT_FETCH_LIMIT:
             break
 
 
+def _shift_auction_events_catchup(after_id):
+    """One-off DB catch-up for a stream behind the buffer window.
+
+    Capped at the buffer head: rows past an unsettled gap are not handed out,
+    otherwise the client's cursor would jump over the late commit.
+    """
+    events = db.get_shift_auction_test_events_after(after_id, limit=SHIFT_AUCTION_EVENT_FETCH_LIMIT)
+    if not shift_auction_event_buffer_ready:
+        return events
+    with shift_auction_event_condition:
+        head_id = shift_auction_event_buffer_max_id
+    return [event for event in events if int(event.get("id") or 0) <= head_id]
+
+
 def _initialize_shift_auction_event_buffer(cursor):
     """Load the recent window once and mark the process-local fan-out ready."""
     global shift_auction_event_buffer_ready, shift_auction_event_signal_id
-    _publish_shift_auction_events(_fetch_recent_shift_auction_events_with_cursor(cursor))
+    recent = _fetch_recent_shift_auction_events_with_cursor(cursor)
+    _publish_shift_auction_events(_contiguous_shift_auction_events(cursor, recent))
     with shift_auction_event_condition:
         shift_auction_event_buffer_ready = True
         # Also wake streams when the table is empty and no event was published.
@@ -756,7 +948,9 @@ def _run_shift_auction_pg_listener():
                 _initialize_shift_auction_event_buffer(cursor)
 
             while True:
-                readable, _, _ = select.select([conn], [], [], SHIFT_AUCTION_EVENT_HEARTBEAT_SECONDS)
+                gap_open = shift_auction_event_gap is not None
+                timeout = SHIFT_AUCTION_EVENT_GAP_POLL_SECONDS if gap_open else SHIFT_AUCTION_EVENT_HEARTBEAT_SECONDS
+                readable, _, _ = select.select([conn], [], [], timeout)
                 # Always poll + drain: a NOTIFY can be absorbed into conn.notifies
                 # as a side effect of running the events query below, so we must
                 # not rely on socket readability alone to detect new events.
@@ -774,9 +968,11 @@ def _run_shift_auction_pg_listener():
                     while conn.notifies:
                         conn.notifies.pop(0)
                         got_notify = True
-                if got_notify:
+                if got_notify or gap_open:
                     # Fetch to exhaustion once, regardless of how many NOTIFYs
                     # arrived. This also handles bursts larger than one page.
+                    # An open gap is re-checked without waiting for a NOTIFY:
+                    # a rolled-back id never sends one.
                     _drain_shift_auction_events(cursor)
         except Exception as error:
             logging.warning("Shift auction event listener reconnecting after error: %s", error, exc_info=True)
@@ -811,6 +1007,40 @@ def _ensure_shift_auction_event_listener_started():
         shift_auction_event_listener_started = True
 
 
+# Движок захватов (shift_auction_engine.py): захваты и отказы идут пачками через
+# нескольких писателей, а захват уже занятого лота отклоняется из памяти.
+# SHIFT_AUCTION_CLAIM_ENGINE=0 возвращает прежний путь «транзакция на запрос».
+SHIFT_AUCTION_CLAIM_ENGINE_ENABLED = _env_bool('SHIFT_AUCTION_CLAIM_ENGINE', True)
+SHIFT_AUCTION_CLAIM_WRITERS = _env_int('SHIFT_AUCTION_CLAIM_WRITERS', 4, minimum=1, maximum=16)
+SHIFT_AUCTION_CLAIM_BATCH_MAX = _env_int('SHIFT_AUCTION_CLAIM_BATCH_MAX', 16, minimum=1, maximum=200)
+
+
+def _shift_auction_claim_engine_events(after_id):
+    """События после after_id из буфера процесса; None — памяти пока верить нельзя."""
+    if not shift_auction_event_buffer_ready:
+        _ensure_shift_auction_event_listener_started()
+        return None
+    events, covered, _signal_id, _floor_id = _read_shift_auction_events_from_buffer(after_id)
+    return events if covered else None
+
+
+def _process_single_shift_auction_lot_request(action, operator_id, lot_id):
+    if action == 'release':
+        return db.release_shift_auction_test_lot(operator_id, lot_id)
+    return db.claim_shift_auction_test_lot(operator_id, lot_id)
+
+
+shift_auction_claim_engine = shift_auction_engine.ShiftAuctionClaimEngine(
+    process_batch=db.process_shift_auction_lot_batch,
+    process_one=_process_single_shift_auction_lot_request,
+    load_lot_states=db.get_shift_auction_lot_states,
+    read_events=_shift_auction_claim_engine_events,
+    lot_event_types=SHIFT_AUCTION_LOT_PATCH_EVENT_TYPES,
+    writers=SHIFT_AUCTION_CLAIM_WRITERS,
+    max_batch=SHIFT_AUCTION_CLAIM_BATCH_MAX,
+)
+
+
 def get_gcs_client():
     # Если используется JSON из переменной окружения
     credentials_content = os.getenv('GOOGLE_APPLICATION_CREDENTIALS_CONTENT')
@@ -1129,12 +1359,16 @@ def _validate_user_session_principal(user_id, session_id=None, user=None):
     return user
 
 
-def _set_request_auth_context(user_id, user=None):
+def _set_request_auth_context(user_id, user=None, principal_scope=None):
     request.environ['HTTP_X_USER_ID'] = str(user_id)
     request.user_id = int(user_id)
     g.user_id = int(user_id)
     if user is not None:
         g.auth_user = user
+    if principal_scope is not None:
+        # Приехал тем же запросом, что и сессия: гвардам маршрутов в базу
+        # за отделом и «главой» ходить уже не нужно (см. _principal_scope).
+        g._principal_scope_cache = {int(user_id): principal_scope}
 
 
 def _should_touch_user_session(session, ip_address=None, user_agent=None):
@@ -1463,7 +1697,7 @@ def _authenticate_access_cookie(optional=True, touch_session=True):
                     user_agent=user_agent
                 )
 
-            _set_request_auth_context(user_id, user=user)
+            _set_request_auth_context(user_id, user=user, principal_scope=session.get("principal_scope"))
             _record_elapsed_server_timing("auth-access", auth_started_at)
             return payload
         except AuthError as auth_error:
@@ -1547,7 +1781,7 @@ def _authenticate_refresh_cookie(optional=True, rotate_tokens=True, rotate_refre
                     )
                     _record_elapsed_server_timing("auth-touch", touch_started_at)
 
-            _set_request_auth_context(user_id, user=user)
+            _set_request_auth_context(user_id, user=user, principal_scope=session.get("principal_scope"))
             _record_elapsed_server_timing("auth-refresh", auth_started_at)
             return payload
         except AuthError as auth_error:
@@ -1825,38 +2059,64 @@ def _sanitize_evaluations_for_access(evaluations, reveal_sensitive, hide_hidden_
     return result
 
 
-def _headed_department_id(requester_id):
-    """id отдела, главой которого является пользователь (кэш в g на запрос).
+def _principal_scope(user_id):
+    """Портрет пользователя для проверок доступа (кэш в g на запрос).
 
-    Возвращает None, если пользователь не глава никакого отдела. Глава отдела
-    получает админ-подобный доступ, но строго в рамках своего отдела.
+    {'department_id', 'headed_department_ids'} — свой отдел и возглавляемые
+    активные отделы, первым «главный» (тот же порядок, что у
+    headed_department_id_for_user). У авторизованного запроса портрет приезжает
+    вместе с сессией и кладётся в g ещё в _set_request_auth_context; для прочих
+    пользователей — один запрос db.get_user_principal_scope с кэшем процесса.
+    None — пользователя нет или база недоступна.
     """
-    if not requester_id:
+    if not user_id:
+        return None
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
         return None
     # Кэш живёт в контексте Flask-запроса. Когда функцию вызывают вне него —
     # например, из обработчика Telegram-бота в executor-потоке — любое обращение
     # к `g` бросает RuntimeError («Working outside of application context»).
-    # В этом случае работаем без кэша, напрямую из БД, чтобы не уронить вызов
+    # В этом случае работаем без кэша запроса, чтобы не уронить вызов
     # (иначе RuntimeError всплывал как «запрос уже обработан» при approve/reject).
     cache = None
     try:
-        cache = getattr(g, '_headed_dept_cache', None)
+        cache = getattr(g, '_principal_scope_cache', None)
         if cache is None:
             cache = {}
-            g._headed_dept_cache = cache
+            g._principal_scope_cache = cache
     except RuntimeError:
         cache = None
     except Exception:
         cache = None
-    if cache is not None and requester_id in cache:
-        return cache[requester_id]
+    if cache is not None and user_id in cache:
+        return cache[user_id]
     try:
-        dept = db.headed_department_id_for_user(requester_id)
+        scope = db.get_user_principal_scope(user_id)
     except Exception:
-        dept = None
+        logging.exception("Не удалось получить портрет пользователя %s", user_id)
+        scope = None
     if cache is not None:
-        cache[requester_id] = dept
-    return dept
+        cache[user_id] = scope
+    return scope
+
+
+def _headed_department_id(requester_id):
+    """id отдела, главой которого является пользователь (из _principal_scope).
+
+    Возвращает None, если пользователь не глава никакого отдела. Глава отдела
+    получает админ-подобный доступ, но строго в рамках своего отдела.
+    """
+    scope = _principal_scope(requester_id)
+    headed = scope['headed_department_ids'] if scope else ()
+    return headed[0] if headed else None
+
+
+def _user_department_id(user_id):
+    """users.department_id из _principal_scope — без отдельного запроса в гвардах."""
+    scope = _principal_scope(user_id)
+    return scope['department_id'] if scope else None
 
 
 def _department_scope_id_for_requester(requester_id):
@@ -1864,41 +2124,13 @@ def _department_scope_id_for_requester(requester_id):
     headed_dept = _headed_department_id(requester_id)
     if headed_dept is not None:
         return headed_dept
-    return db.get_user_department_id(requester_id)
+    return _user_department_id(requester_id)
 
 
 def _headed_department_ids(requester_id):
-    """All active departments formally headed by the requester (cached per request)."""
-    if not requester_id:
-        return frozenset()
-
-    cache = None
-    try:
-        cache = getattr(g, '_headed_dept_ids_cache', None)
-        if cache is None:
-            cache = {}
-            g._headed_dept_ids_cache = cache
-    except RuntimeError:
-        cache = None
-    except Exception:
-        cache = None
-
-    if cache is not None and requester_id in cache:
-        return cache[requester_id]
-
-    try:
-        departments = db.get_headed_departments_for_user(requester_id) or []
-        department_ids = frozenset(
-            int(item.get('id'))
-            for item in departments
-            if isinstance(item, dict) and item.get('id') is not None
-        )
-    except Exception:
-        department_ids = frozenset()
-
-    if cache is not None:
-        cache[requester_id] = department_ids
-    return department_ids
+    """All active departments formally headed by the requester (from _principal_scope)."""
+    scope = _principal_scope(requester_id)
+    return frozenset(scope['headed_department_ids']) if scope else frozenset()
 
 
 def _is_department_manager_requester(requester_role, requester_id):
@@ -2484,6 +2716,11 @@ AVATAR_UPLOAD_FOLDER = (os.getenv('AVATAR_UPLOAD_FOLDER') or 'AvatarUploads/').s
 AVATAR_THUMBNAIL_SUFFIX = (os.getenv('AVATAR_THUMBNAIL_SUFFIX') or '128').strip() or '128'
 AVATAR_SIGNED_URL_CACHE = {}
 AVATAR_SIGNED_URL_CACHE_LOCK = threading.Lock()
+# Второй уровень за кэшами процесса — таблица shared_cache (UNLOGGED) в той же базе:
+# процессов waitress может быть несколько, и без неё каждый подписывал бы свои ссылки
+# на аватары (у браузера — промах кэша на каждом переключении процесса) и сам ходил бы
+# за снимками табло. SHARED_CACHE_ENABLED=0 оставляет только кэши процессов.
+SHARED_CACHE_ENABLED = _env_bool('SHARED_CACHE_ENABLED', True)
 FOUR_YOU_ADMIN_USER_ID = int(os.getenv('FOUR_YOU_ADMIN_USER_ID', '2'))
 FOUR_YOU_VIEWER_USER_ID = int(os.getenv('FOUR_YOU_VIEWER_USER_ID', '241') or 241)
 AI_QA_EXTRA_ACCESS_USER_IDS = {183}
@@ -3565,19 +3802,53 @@ def _send_task_completion_attachments_to_telegram(chat_id, task_subject, attachm
     return warnings
 
 
+def _shared_cache_read(key):
+    """Значение из общего кэша процессов или None: выключен, записи нет, база не ответила."""
+    if not SHARED_CACHE_ENABLED:
+        return None
+    try:
+        value, _expires_at = db.shared_cache_get(key)
+    except Exception as exc:
+        logging.debug("Общий кэш: не удалось прочитать %s: %s", key, exc)
+        return None
+    return value
+
+
+def _shared_cache_write(key, value, ttl_seconds, keep_remaining_seconds=None):
+    """Положить значение в общий кэш; вернуть то, что там лежит в итоге (или None).
+
+    Ошибку глотаем: общий кэш — ускорение, процесс без него работает на своём."""
+    if not SHARED_CACHE_ENABLED:
+        return None
+    try:
+        stored, _expires_at = db.shared_cache_put(
+            key, value, ttl_seconds, keep_remaining_seconds=keep_remaining_seconds)
+    except Exception as exc:
+        logging.debug("Общий кэш: не удалось записать %s: %s", key, exc)
+        return None
+    return stored
+
+
 def _build_avatar_signed_url(bucket_name, blob_path):
     bucket_name = (bucket_name or '').strip()
     blob_path = (blob_path or '').strip()
     if not bucket_name or not blob_path:
         return None
     cache_key = (bucket_name, blob_path)
+    shared_key = f"avatar_url:{bucket_name}/{blob_path}"
     now_ts = time.time()
+    min_expires_at = now_ts + AVATAR_SIGNED_URL_CACHE_MIN_REMAINING_SECONDS
     with AVATAR_SIGNED_URL_CACHE_LOCK:
         cached = AVATAR_SIGNED_URL_CACHE.get(cache_key)
-        if cached and cached.get('expires_at', 0) > (now_ts + AVATAR_SIGNED_URL_CACHE_MIN_REMAINING_SECONDS):
+        if cached and cached.get('expires_at', 0) > min_expires_at:
             return cached.get('url')
         if cached:
             AVATAR_SIGNED_URL_CACHE.pop(cache_key, None)
+    # Ссылку мог уже подписать соседний процесс — тогда у всех она одна.
+    shared = _shared_cache_read(shared_key)
+    if shared and shared.get('url') and float(shared.get('expires_at') or 0) > min_expires_at:
+        _remember_avatar_signed_url(cache_key, shared['url'], float(shared['expires_at']), now_ts)
+        return shared['url']
     try:
         gcs_client = get_gcs_client()
         bucket = gcs_client.bucket(bucket_name)
@@ -3588,29 +3859,40 @@ def _build_avatar_signed_url(bucket_name, blob_path):
             method="GET"
         )
         expires_at = now_ts + AVATAR_SIGNED_URL_TTL_SECONDS
-        with AVATAR_SIGNED_URL_CACHE_LOCK:
-            AVATAR_SIGNED_URL_CACHE[cache_key] = {
-                "url": signed_url,
-                "expires_at": expires_at
-            }
-            if len(AVATAR_SIGNED_URL_CACHE) > AVATAR_SIGNED_URL_CACHE_MAX_ITEMS:
-                stale_keys = [k for k, v in AVATAR_SIGNED_URL_CACHE.items() if v.get('expires_at', 0) <= now_ts]
-                for stale_key in stale_keys:
-                    AVATAR_SIGNED_URL_CACHE.pop(stale_key, None)
-                overflow = len(AVATAR_SIGNED_URL_CACHE) - AVATAR_SIGNED_URL_CACHE_MAX_ITEMS
-                if overflow > 0:
-                    oldest_keys = sorted(
-                        AVATAR_SIGNED_URL_CACHE.items(),
-                        key=lambda item: item[1].get('expires_at', 0)
-                    )[:overflow]
-                    for oldest_key, _ in oldest_keys:
-                        AVATAR_SIGNED_URL_CACHE.pop(oldest_key, None)
+        stored = _shared_cache_write(
+            shared_key, {"url": signed_url, "expires_at": expires_at},
+            AVATAR_SIGNED_URL_TTL_SECONDS,
+            keep_remaining_seconds=AVATAR_SIGNED_URL_CACHE_MIN_REMAINING_SECONDS)
+        if stored and stored.get('url') and float(stored.get('expires_at') or 0) > min_expires_at:
+            # Сосед успел раньше — берём его ссылку, свою выбрасываем.
+            signed_url, expires_at = stored['url'], float(stored['expires_at'])
+        _remember_avatar_signed_url(cache_key, signed_url, expires_at, now_ts)
         return signed_url
     except Exception as e:
         logging.warning(f"Failed to build avatar signed URL for bucket={bucket_name}: {e}")
         return None
 
 
+def _remember_avatar_signed_url(cache_key, signed_url, expires_at, now_ts):
+    with AVATAR_SIGNED_URL_CACHE_LOCK:
+        AVATAR_SIGNED_URL_CACHE[cache_key] = {
+            "url": signed_url,
+            "expires_at": expires_at
+        }
+        if len(AVATAR_SIGNED_URL_CACHE) > AVATAR_SIGNED_URL_CACHE_MAX_ITEMS:
+            stale_keys = [k for k, v in AVATAR_SIGNED_URL_CACHE.items() if v.get('expires_at', 0) <= now_ts]
+            for stale_key in stale_keys:
+                AVATAR_SIGNED_URL_CACHE.pop(stale_key, None)
+            overflow = len(AVATAR_SIGNED_URL_CACHE) - AVATAR_SIGNED_URL_CACHE_MAX_ITEMS
+            if overflow > 0:
+                oldest_keys = sorted(
+                    AVATAR_SIGNED_URL_CACHE.items(),
+                    key=lambda item: item[1].get('expires_at', 0)
+                )[:overflow]
+                for oldest_key, _ in oldest_keys:
+                    AVATAR_SIGNED_URL_CACHE.pop(oldest_key, None)
+
+
 def _sanitize_avatar_extension(source_filename, fallback='.webp'):
     safe_name = secure_filename(source_filename or "")
     extension = os.path.splitext(safe_name)[1].lower()
@@ -4485,11 +4767,12 @@ def after_request(response):
         response.headers['Cache-Control'] = 'no-store'
         response.headers['Pragma'] = 'no-cache'
 
+    _append_db_pool_server_timing()
     timings = getattr(g, 'server_timings', None)
     if timings:
         response.headers['Server-Timing'] = ', '.join(
-            f"{name};dur={duration:.2f}"
-            for name, duration in timings
+            f"{name};dur={duration:.2f}" + (f';desc="{desc}"' if desc else '')
+            for name, duration, desc in timings
         )
 
     pending_tokens = getattr(g, 'pending_auth_tokens', None)
@@ -4669,12 +4952,16 @@ def api_ai_qa_review_queue():
         scope = _ai_qa_direction_scope(requester_id)
         limit = int(request.args.get('limit', 30))
         offset = int(request.args.get('offset', 0))
+        after = request.args.get('after') or None
         subject = _ai_qa_subject_kind(request.args.get('subject'))
         items = review_queue_list(limit=limit, offset=offset, allowed_direction_ids=scope,
-                                  subject_kind=subject)
+                                  subject_kind=subject, after=after)
         total = review_queue_count(allowed_direction_ids=scope, subject_kind=subject)
         return jsonify({"status": "success", "items": items, "subject": subject,
-                        "total": total, "limit": limit, "offset": offset}), 200
+                        "total": total, "limit": limit, "offset": offset,
+                        "next_cursor": items[-1].get("cursor") if items else None}), 200
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
     except Exception as error:
         logging.exception("ai-qa review-queue failed")
         return jsonify({"error": str(error)}), 500
@@ -5508,7 +5795,7 @@ def _c2d_api_get(path, params=None):
     authorization = _chat2desk_authorization_header()
     if not authorization:
         raise RuntimeError("CHAT2DESK_API_TOKEN не задан")
-    response = requests.get(
+    response = _chat2desk_session.get(
         f"{_chat2desk_api_base_url()}{path}",
         headers={'Authorization': authorization, 'Accept': 'application/json'},
         params=params or {},
@@ -6328,7 +6615,7 @@ def _chatapp_guard():
     if department_id is not None:
         if _headed_department_id(requester_id) == department_id:
             return requester_id, None
-        if _is_supervisor_role(role) and db.get_user_department_id(requester_id) == department_id:
+        if _is_supervisor_role(role) and _user_department_id(requester_id) == department_id:
             return requester_id, None
     return requester_id, (jsonify({"error": "forbidden"}), 403)
 
@@ -7399,12 +7686,15 @@ def api_resource_fte_sync_oktell():
         return _resource_fte_error_response(error)
 
 
-def _oktell_billing_range_exceeds_limit(start_day, end_day):
-    return (end_day - start_day).days + 1 > OKTELL_BILLING_MAX_RANGE_DAYS
+def _oktell_billing_range_exceeds_limit(start_day, end_day, max_days=None):
+    return (end_day - start_day).days + 1 > (max_days or OKTELL_BILLING_MAX_RANGE_DAYS)
 
 
-def _oktell_billing_parse_date_args():
-    """Период биллинга без зависимости от Oktell (для локальных отчётов)."""
+def _oktell_billing_parse_date_args(max_days=None):
+    """Период биллинга без зависимости от Oktell (для локальных отчётов).
+
+    max_days — свой потолок периода (фоновая выгрузка длиннее синхронного отчёта)."""
+    max_days = max_days or OKTELL_BILLING_MAX_RANGE_DAYS
     date_from = request.args.get('date_from') or request.args.get('date') or None
     date_to = request.args.get('date_to') or date_from
     start_day = _oktell_parse_date(date_from)
@@ -7413,8 +7703,8 @@ def _oktell_billing_parse_date_args():
         return None, jsonify({"error": "date_from и date_to обязательны в формате YYYY-MM-DD"}), 400
     if end_day < start_day:
         return None, jsonify({"error": "date_to должен быть не раньше date_from"}), 400
-    if _oktell_billing_range_exceeds_limit(start_day, end_day):
-        return None, jsonify({"error": f"Период отчета не может быть больше {OKTELL_BILLING_MAX_RANGE_DAYS} дней"}), 400
+    if _oktell_billing_range_exceeds_limit(start_day, end_day, max_days):
+        return None, jsonify({"error": f"Период отчета не может быть больше {max_days} дней"}), 400
 
     return {
         'start_day': start_day,
@@ -7422,9 +7712,9 @@ def _oktell_billing_parse_date_args():
     }, None, None
 
 
-def _oktell_billing_parse_request_args():
+def _oktell_billing_parse_request_args(max_days=None):
     """Общий разбор параметров отчётов Oktell, включая время и готовность интеграции."""
-    params, error_response, error_status = _oktell_billing_parse_date_args()
+    params, error_response, error_status = _oktell_billing_parse_date_args(max_days)
     if params is None:
         return None, error_response, error_status
 
@@ -7672,6 +7962,79 @@ def api_resource_fte_oktell_billing_export():
     )
 
 
+# --- Построчный биллинг фоновой задачей -----------------------------------------------------------
+# Синхронная выгрузка mode=detail листает весь период одним списком в нити waitress. Задача
+# делает то же самое по суткам: каждые сутки — чекпоинт, упавший Oktell стоит одного дня,
+# а не всей выгрузки. Параметры задачи — уже разобранный период (права проверены при постановке).
+
+def _oktell_billing_detail_job_range(params):
+    return _oktell_parse_date(params.get('date_from')), _oktell_parse_date(params.get('date_to'))
+
+
+def _oktell_billing_detail_job_plan(params):
+    start_day, end_day = _oktell_billing_detail_job_range(params)
+    # От поздних суток к ранним: синхронная выгрузка листает по убыванию Id, и склейка
+    # суток в этом порядке даёт файл с тем же порядком строк.
+    return [
+        (end_day - timedelta(days=offset)).strftime('%Y-%m-%d')
+        for offset in range((end_day - start_day).days + 1)
+    ]
+
+
+def _oktell_billing_detail_job_unit(params, unit, context):
+    day = _oktell_parse_date(unit)
+    return _oktell_fetch_billing_detail_export_rows(
+        day, day, int(params['minute_from']), int(params['minute_to']))
+
+
+def _oktell_billing_detail_job_build(params, chunks, output, context):
+    start_day, end_day = _oktell_billing_detail_job_range(params)
+    report_params = {
+        'start_day': start_day,
+        'end_day': end_day,
+        'minute_from': int(params['minute_from']),
+        'minute_to': int(params['minute_to']),
+    }
+    rows = [row for day_rows in chunks for row in (day_rows or [])]
+    workbook = _oktell_billing_export_workbook(
+        'detail', report_params, {'rows': rows}, OKTELL_BILLING_SL_DEFAULT_SECONDS)
+    shutil.copyfileobj(workbook, output)
+    return (
+        "oktell_billing_detail_"
+        f"{start_day.strftime('%Y-%m-%d')}_{end_day.strftime('%Y-%m-%d')}.xlsx"
+    )
+
+
+export_jobs.register(export_jobs.ExportKind(
+    'oktell_billing_detail',
+    plan=_oktell_billing_detail_job_plan,
+    run_unit=_oktell_billing_detail_job_unit,
+    build=_oktell_billing_detail_job_build,
+))
+
+
+@app.route('/api/resource_fte/oktell_billing_export/jobs', methods=['POST', 'OPTIONS'])
+@require_api_key
+def api_resource_fte_oktell_billing_export_job():
+    """Построчный биллинг Oktell фоновой задачей: период до OKTELL_BILLING_EXPORT_JOB_MAX_DAYS."""
+    if request.method == 'OPTIONS':
+        return _build_cors_preflight_response()
+    requester_id, guard_response, guard_status = _resource_fte_route_guard()
+    if guard_response is not None:
+        return guard_response, guard_status
+
+    params, error_response, error_status = _oktell_billing_parse_request_args(
+        OKTELL_BILLING_EXPORT_JOB_MAX_DAYS)
+    if params is None:
+        return error_response, error_status
+    return _export_job_enqueue_response('oktell_billing_detail', requester_id, {
+        'date_from': params['start_day'].strftime('%Y-%m-%d'),
+        'date_to': params['end_day'].strftime('%Y-%m-%d'),
+        'minute_from': params['minute_from'],
+        'minute_to': params['minute_to'],
+    })
+
+
 @app.route('/api/resource_fte/day/<string:report_date>', methods=['GET', 'OPTIONS'])
 @require_api_key
 def api_resource_fte_day(report_date):
@@ -7966,9 +8329,15 @@ def api_shift_auction_test_snapshot():
         requester_role = _normalize_user_role(requester[3])
         is_admin_requester = _is_admin_role(requester_role)
         can_monitor_auction = is_admin_requester or _is_supervisor_role(requester_role)
+        # since=<версия>: клиент уже держит снимок этой версии и просит только изменения.
+        try:
+            since_version = int(request.args.get('since') or 0) or None
+        except (TypeError, ValueError):
+            since_version = None
         snapshot = db.get_shift_auction_test_snapshot(
             current_user_id=requester_id,
-            include_admin_fields=can_monitor_auction
+            include_admin_fields=can_monitor_auction,
+            since_version=since_version
         )
         has_period_history_access = False
         if not (can_monitor_auction or snapshot.get('is_current_user_tester')):
@@ -8376,10 +8745,10 @@ def _shift_auction_test_lot_mutation_response(lot_id, action):
         if _normalize_user_role(requester[3]) != 'operator':
             return jsonify({"error": "Only operators can claim shifts"}), 403
         mutation_started_at = time.perf_counter()
-        if action == 'release':
-            result = db.release_shift_auction_test_lot(requester_id, lot_id)
+        if SHIFT_AUCTION_CLAIM_ENGINE_ENABLED:
+            result = shift_auction_claim_engine.submit(action, requester_id, lot_id)
         else:
-            result = db.claim_shift_auction_test_lot(requester_id, lot_id)
+            result = _process_single_shift_auction_lot_request(action, requester_id, lot_id)
         db_timings = result.pop("_timings", None) if isinstance(result, dict) else None
         _record_elapsed_server_timing("auction-mutation", mutation_started_at)
         if isinstance(db_timings, dict):
@@ -8388,6 +8757,8 @@ def _shift_auction_test_lot_mutation_response(lot_id, action):
         return jsonify({"status": "success", **result}), 200
     except ValueError as error:
         return _shift_auction_test_error_response(error)
+    except shift_auction_engine.ShiftAuctionEngineBusy:
+        return jsonify({"error": "Shift auction is busy, try again"}), 503
     except Exception as error:
         logging.error(f"Shift auction claim API error: {error}", exc_info=True)
         return jsonify({"error": "Internal server error"}), 500
@@ -8673,16 +9044,12 @@ def api_shift_auction_test_day_off():
         return jsonify({"error": "Internal server error"}), 500
 
 
-@app.route('/api/shift_auction/test_events', methods=['GET', 'OPTIONS'])
-@require_api_key
-def api_shift_auction_test_events():
-    if request.method == 'OPTIONS':
-        return _build_cors_preflight_response()
-
+def _shift_auction_events_access():
+    """(requester_id, ошибка) для ленты событий аукциона — общая для маршрута и SSE-шлюза."""
     requester_id, requester, auth_error = _get_authenticated_requester()
     if auth_error:
         message, status_code = auth_error
-        return jsonify({"error": message}), status_code
+        return None, (jsonify({"error": message}), status_code)
 
     requester_role = _normalize_user_role(requester[3])
     if not (
@@ -8690,12 +9057,22 @@ def api_shift_auction_test_events():
         or _is_supervisor_role(requester_role)
         or db.is_shift_auction_test_participant(requester_id)
     ):
-        return jsonify({"error": "Forbidden"}), 403
+        return None, (jsonify({"error": "Forbidden"}), 403)
+    return requester_id, None
 
-    try:
-        last_event_id = int(request.args.get('after') or 0)
-    except Exception:
-        last_event_id = 0
+
+@app.route('/api/shift_auction/test_events', methods=['GET', 'OPTIONS'])
+@require_api_key
+def api_shift_auction_test_events():
+    if request.method == 'OPTIONS':
+        return _build_cors_preflight_response()
+
+    _requester_id, access_error = _shift_auction_events_access()
+    if access_error:
+        return access_error
+
+    last_event_id = sse_gateway.resume_event_id(
+        request.args.get('after'), request.headers.get('Last-Event-ID'))
 
     _ensure_shift_auction_event_listener_started()
 
@@ -8710,7 +9087,7 @@ def api_shift_auction_test_events():
             if not covered:
                 # Client is behind the in-memory window (fresh connect or long
                 # disconnect). One-off DB catch-up, then resume from RAM.
-                events = db.get_shift_auction_test_events_after(last_event_id, limit=SHIFT_AUCTION_EVENT_FETCH_LIMIT)
+                events = _shift_auction_events_catchup(last_event_id)
                 if not events and buffer_floor_id is not None:
                     # Old rows may have been pruned. Advance across the deleted
                     # gap so this stream can resume from the in-memory window.
@@ -9026,6 +9403,247 @@ def list_admin_sessions():
         return jsonify({"error": "Internal server error"}), 500
 
 
+@app.route('/api/admin/db_pool_stats', methods=['GET', 'POST', 'OPTIONS'])
+@require_api_key
+def admin_db_pool_stats():
+    """Кто и сколько держит пул PostgreSQL: ожидание, удержание, запросы на выдачу.
+
+    GET — сводка по потребителям (маршруты, джобы, пулы нитей) с квотами.
+    POST — то же, но счётчики после ответа обнуляются: удобно замерить окно
+    «до и после» вокруг тяжёлой выгрузки.
+    """
+    try:
+        requester_id = getattr(g, 'user_id', None)
+        if not requester_id:
+            return jsonify({"error": "Unauthorized"}), 401
+
+        requester = db.get_user(id=requester_id)
+        if not requester or not _is_admin_role(requester[3]):
+            return jsonify({"error": "Forbidden: only admins can access"}), 403
+
+        stats = pg_pool_metrics.snapshot()
+        if request.method == 'POST':
+            pg_pool_metrics.reset_stats()
+        stats['pool'].update({
+            "min_conn": MIN_CONN,
+            "max_conn": MAX_CONN,
+            "acquire_timeout_seconds": POOL_ACQUIRE_TIMEOUT_SECONDS,
+        })
+        return jsonify({"status": "success", **stats}), 200
+    except Exception as e:
+        logging.error(f"admin_db_pool_stats error: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route('/api/admin/http_clients/stats', methods=['GET', 'POST', 'OPTIONS'])
+@require_api_key
+def admin_http_clients_stats():
+    """Внешние интеграции через общий HTTP-слой: задержки, ошибки, повторы, паузы по 429.
+
+    GET — сводка по интеграциям; POST — то же, со сбросом счётчиков после ответа.
+    """
+    try:
+        requester_id = getattr(g, 'user_id', None)
+        if not requester_id:
+            return jsonify({"error": "Unauthorized"}), 401
+
+        requester = db.get_user(id=requester_id)
+        if not requester or not _is_admin_role(requester[3]):
+            return jsonify({"error": "Forbidden: only admins can access"}), 403
+
+        stats = http_clients.snapshot()
+        if request.method == 'POST':
+            http_clients.reset_stats()
+        return jsonify({"status": "success", **stats}), 200
+    except Exception as e:
+        logging.error(f"admin_http_clients_stats error: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route('/api/admin/scheduler_jobs/stats', methods=['GET', 'POST', 'OPTIONS'])
+@require_api_key
+def admin_scheduler_jobs_stats():
+    """Джобы планировщика по пулам: очередь, длительность, перебеги интервала, ошибки.
+
+    GET — сводка; POST — то же, со сбросом счётчиков после ответа.
+    """
+    try:
+        requester_id = getattr(g, 'user_id', None)
+        if not requester_id:
+            return jsonify({"error": "Unauthorized"}), 401
+
+        requester = db.get_user(id=requester_id)
+        if not requester or not _is_admin_role(requester[3]):
+            return jsonify({"error": "Forbidden: only admins can access"}), 403
+
+        stats = scheduler_job_pools.snapshot()
+        if request.method == 'POST':
+            scheduler_job_pools.reset_stats()
+        return jsonify({"status": "success", **stats}), 200
+    except Exception as e:
+        logging.error(f"admin_scheduler_jobs_stats error: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route('/api/admin/scheduler_jobs/trends', methods=['GET', 'OPTIONS'])
+@require_api_key
+def admin_scheduler_jobs_trends():
+    """Журнал джоб за days дней: p50/p95 длительности по периодам (bucket=day|hour) и тревога,
+    если p95 подбирается к интервалу расписания. job_id — одна джоба."""
+    try:
+        requester_id = getattr(g, 'user_id', None)
+        if not requester_id:
+            return jsonify({"error": "Unauthorized"}), 401
+
+        requester = db.get_user(id=requester_id)
+        if not requester or not _is_admin_role(requester[3]):
+            return jsonify({"error": "Forbidden: only admins can access"}), 403
+
+        buckets = db.get_scheduler_job_run_trends(
+            days=request.args.get('days', 7),
+            bucket=request.args.get('bucket', 'day'),
+            job_id=request.args.get('job_id') or None,
+        )
+        jobs = scheduler_pools.trend_report(buckets)
+        return jsonify({
+            "status": "success",
+            "jobs": jobs,
+            "alerts": [job['job_id'] for job in jobs if job['alert']],
+            "near_overlap_ratio": scheduler_pools.NEAR_OVERLAP_RATIO,
+        }), 200
+    except ValueError:
+        return jsonify({"error": "days must be a number"}), 400
+    except Exception as e:
+        logging.error(f"admin_scheduler_jobs_trends error: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route('/api/admin/scheduler_jobs/runs', methods=['GET', 'OPTIONS'])
+@require_api_key
+def admin_scheduler_jobs_runs():
+    """Последние прогоны из журнала джоб — всех или одной (job_id)."""
+    try:
+        requester_id = getattr(g, 'user_id', None)
+        if not requester_id:
+            return jsonify({"error": "Unauthorized"}), 401
+
+        requester = db.get_user(id=requester_id)
+        if not requester or not _is_admin_role(requester[3]):
+            return jsonify({"error": "Forbidden: only admins can access"}), 403
+
+        items = db.get_scheduler_job_runs(
+            job_id=request.args.get('job_id') or None,
+            limit=request.args.get('limit', 50),
+        )
+        return jsonify({"status": "success", "items": items}), 200
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+    except Exception as e:
+        logging.error(f"admin_scheduler_jobs_runs error: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route('/api/admin/oktell_gateway/stats', methods=['GET', 'POST', 'OPTIONS'])
+@require_api_key
+def admin_oktell_gateway_stats():
+    """Нагрузка на прокси Oktell через общий шлюз: очередь, кэш закрытых дней, потребители.
+
+    GET — сводка; POST — то же, со сбросом счётчиков после ответа. ?clear_cache=1 в POST
+    ещё и очищает кэш (например, после ручной правки данных в Oktell задним числом).
+    """
+    try:
+        requester_id = getattr(g, 'user_id', None)
+        if not requester_id:
+            return jsonify({"error": "Unauthorized"}), 401
+
+        requester = db.get_user(id=requester_id)
+        if not requester or not _is_admin_role(requester[3]):
+            return jsonify({"error": "Forbidden: only admins can access"}), 403
+
+        stats = _oktell_gateway.snapshot()
+        if request.method == 'POST':
+            _oktell_gateway.reset_stats()
+            if str(request.args.get('clear_cache', '')).strip().lower() in ('1', 'true', 'yes'):
+                _oktell_gateway.clear_cache()
+        return jsonify({"status": "success", **stats}), 200
+    except Exception as e:
+        logging.error(f"admin_oktell_gateway_stats error: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route('/api/admin/oktell_billing_cache/reset', methods=['POST', 'OPTIONS'])
+@require_api_key
+def admin_reset_oktell_billing_cache():
+    """Сброс кэша закрытых суток «Биллинга Oktell» (oktell_billing_days).
+
+    Нужен, если данные в Oktell поправили задним числом. ?date_from / ?date_to (YYYY-MM-DD)
+    ограничивают период, ?kind — вид (park, line, operator_calls, operator_states); без
+    параметров сбрасывается всё. Сбрасывается и кэш закрытых дней в шлюзе к прокси.
+    """
+    if request.method == 'OPTIONS':
+        return _build_cors_preflight_response()
+    try:
+        requester_id = getattr(g, 'user_id', None)
+        if not requester_id:
+            return jsonify({"error": "Unauthorized"}), 401
+
+        requester = db.get_user(id=requester_id)
+        if not requester or not _is_admin_role(requester[3]):
+            return jsonify({"error": "Forbidden: only admins can access"}), 403
+
+        bounds = {}
+        for key in ('date_from', 'date_to'):
+            raw = str(request.args.get(key) or '').strip()
+            if not raw:
+                bounds[key] = None
+                continue
+            try:
+                bounds[key] = datetime.strptime(raw, '%Y-%m-%d').date()
+            except ValueError:
+                return jsonify({"error": f"{key} должен быть в формате YYYY-MM-DD"}), 400
+        kind = str(request.args.get('kind') or '').strip() or None
+        if kind is not None and kind not in OKTELL_BILLING_FORMULA_VERSIONS:
+            return jsonify({"error": "kind должен быть одним из: "
+                                     + ", ".join(sorted(OKTELL_BILLING_FORMULA_VERSIONS))}), 400
+
+        deleted = db.delete_oktell_billing_days(bounds['date_from'], bounds['date_to'], kind)
+        _oktell_gateway.clear_cache()
+        return jsonify({"status": "success", "deleted_days": deleted}), 200
+    except Exception as e:
+        logging.error(f"admin_reset_oktell_billing_cache error: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route('/api/admin/month_rollups/check', methods=['GET', 'POST', 'OPTIONS'])
+@require_api_key
+def admin_check_month_rollups():
+    """Сверка свёртки «оператор × месяц» («Учёт часов») с пересчётом с нуля.
+
+    GET — только отчёт о расхождениях; POST — ещё и чинит расходящиеся строки.
+    ?month=YYYY-MM ограничивает сверку одним месяцем, без него — все собранные.
+    """
+    try:
+        requester_id = getattr(g, 'user_id', None)
+        if not requester_id:
+            return jsonify({"error": "Unauthorized"}), 401
+
+        requester = db.get_user(id=requester_id)
+        if not requester or not _is_admin_role(requester[3]):
+            return jsonify({"error": "Forbidden: only admins can access"}), 403
+
+        month = (request.args.get('month') or '').strip() or None
+        if month:
+            try:
+                datetime.strptime(month, '%Y-%m')
+            except ValueError:
+                return jsonify({"error": "Invalid month format, expected YYYY-MM"}), 400
+        result = db.check_operator_month_rollups(month=month, repair=request.method == 'POST')
+        return jsonify({"status": "success", **result}), 200
+    except Exception as e:
+        logging.error(f"admin_check_month_rollups error: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+
 @app.route('/api/admin/sessions/<session_id>/revoke', methods=['POST', 'OPTIONS'])
 @require_api_key
 def revoke_admin_session(session_id):
@@ -24426,237 +25044,290 @@ def build_offline_activities_map(activities_list):
         amap.setdefault(op, {}).setdefault(day, []).append(item)
     return amap
 
-@app.route('/api/report/monthly_hours', methods=['GET'])
-@require_api_key
-def get_monthly_report_hours():
-    try:
-        supervisor_id = request.args.get('supervisor_id')
-        group_param = request.args.get('group_id')
-        group_id = int(group_param) if group_param and str(group_param).isdigit() else None
-        month = request.args.get('month')
-        if not month or not MONTH_RE.match(month):
-            return jsonify({"error": "month required in format YYYY-MM"}), 400
-        _report_year, _report_mon = map(int, month.split('-'))
-        _report_start = dt_date(_report_year, _report_mon, 1)
-        _report_end = dt_date(_report_year, _report_mon, calendar.monthrange(_report_year, _report_mon)[1])
+# Отчёт «Учёта часов» пишется потоково во временный файл и отдаётся из него
+# кусками (wsgi.file_wrapper): до этого порога файл живёт в памяти, дальше — на диске.
+MONTHLY_HOURS_REPORT_SPOOL_BYTES = _env_int(
+    'MONTHLY_HOURS_REPORT_SPOOL_BYTES', 4 * 1024 * 1024, minimum=0
+)
 
-        requester_id, requester, auth_error = _get_authenticated_requester()
-        if auth_error:
-            message, status_code = auth_error
-            return jsonify({"error": message}), status_code
 
-        role = _normalize_user_role(requester[3])
-        headed_dept_id = _headed_department_id(requester_id)
-        effective_role, scope_department_id = _effective_management_scope(requester, requester_id)
-        if not (_is_admin_role(role) or _is_supervisor_role(role) or headed_dept_id is not None):
-            return jsonify({"error": "Unauthorized to access this report"}), 403
-        generate_all = False
+def _monthly_hours_report_scope():
+    """Параметры и права отчёта «Учёта часов»: (scope, None) или (None, (ответ, статус)).
 
-        if group_id is not None:
-            # Отчёт строго в рамках группы за месяц: все операторы — одной модели расчёта,
-            # поэтому листы выбираются корректно (чат-группа → без «Звонки»/«Эффективность»).
-            # СВ может выгружать только группы своего отдела (или те, что ведёт); админ — любые.
-            if not _is_global_admin_requester(role, requester_id):
-                _grp = db.get_group(group_id)
-                _sv_dept = scope_department_id
-                _allowed = (
-                    (_grp and _sv_dept is not None and _grp.get('department_id') == _sv_dept)
-                    or db.supervisor_has_group_access_for_period(
-                        requester_id, group_id, _report_start, _report_end
-                    )
-                )
-                if not _allowed:
-                    return jsonify({"error": "Forbidden: not your department's group"}), 403
-            supervisor_id = None
-        elif not supervisor_id:
-            generate_all = True
-        else:
-            try:
-                supervisor_id = int(supervisor_id)
-            except ValueError:
-                return jsonify({"error": "supervisor_id must be integer"}), 400
-            if not _is_global_admin_requester(role, requester_id):
-                target_supervisor, scope_error = _load_target_user_with_scope(
-                    requester,
-                    requester_id,
-                    supervisor_id,
-                    allow_self=True,
-                    supervisor_target_roles=('sv', 'supervisor'),
-                    not_found_message="Supervisor not found",
-                    forbidden_message="Forbidden: supervisor is outside your department"
-                )
-                if scope_error:
-                    message, status_code = scope_error
-                    return jsonify({"error": message}), status_code
-                if _normalize_user_role(target_supervisor[3]) != 'sv':
-                    return jsonify({"error": "Supervisor not found"}), 404
+    scope — JSON-совместимый словарь: по нему собирает файл и синхронная ручка, и фоновая
+    задача (права у задачи проверены здесь же, при постановке)."""
+    supervisor_id = request.args.get('supervisor_id')
+    group_param = request.args.get('group_id')
+    group_id = int(group_param) if group_param and str(group_param).isdigit() else None
+    month = request.args.get('month')
+    if not month or not MONTH_RE.match(month):
+        return None, (jsonify({"error": "month required in format YYYY-MM"}), 400)
+    _report_year, _report_mon = map(int, month.split('-'))
+    _report_start = dt_date(_report_year, _report_mon, 1)
+    _report_end = dt_date(_report_year, _report_mon, calendar.monthrange(_report_year, _report_mon)[1])
 
-        logging.info("Начало генерации отчета: supervisor_id=%s group_id=%s month=%s generate_all=%s", supervisor_id, group_id, month, generate_all)
+    requester_id, requester, auth_error = _get_authenticated_requester()
+    if auth_error:
+        message, status_code = auth_error
+        return None, (jsonify({"error": message}), status_code)
 
-        try:
-            if generate_all:
-                operators = db.get_daily_hours_for_all_month(
-                    month,
-                    department_id=None if _is_global_admin_requester(role, requester_id) else scope_department_id
+    role = _normalize_user_role(requester[3])
+    headed_dept_id = _headed_department_id(requester_id)
+    effective_role, scope_department_id = _effective_management_scope(requester, requester_id)
+    if not (_is_admin_role(role) or _is_supervisor_role(role) or headed_dept_id is not None):
+        return None, (jsonify({"error": "Unauthorized to access this report"}), 403)
+    generate_all = False
+
+    if group_id is not None:
+        # Отчёт строго в рамках группы за месяц: все операторы — одной модели расчёта,
+        # поэтому листы выбираются корректно (чат-группа → без «Звонки»/«Эффективность»).
+        # СВ может выгружать только группы своего отдела (или те, что ведёт); админ — любые.
+        if not _is_global_admin_requester(role, requester_id):
+            _grp = db.get_group(group_id)
+            _sv_dept = scope_department_id
+            _allowed = (
+                (_grp and _sv_dept is not None and _grp.get('department_id') == _sv_dept)
+                or db.supervisor_has_group_access_for_period(
+                    requester_id, group_id, _report_start, _report_end
                 )
-            elif group_id is not None:
-                operators = db.get_daily_hours_by_group_month(group_id, month)
-            else:
-                operators = db.get_daily_hours_by_supervisor_month(supervisor_id, month)
-        except Exception as e:
-            logging.exception("Ошибка получения operators из db")
-            return jsonify({"error": "Ошибка получения операторов"}), 500
+            )
+            if not _allowed:
+                return None, (jsonify({"error": "Forbidden: not your department's group"}), 403)
+        supervisor_id = None
+    elif not supervisor_id:
+        generate_all = True
+    else:
+        try:
+            supervisor_id = int(supervisor_id)
+        except ValueError:
+            return None, (jsonify({"error": "supervisor_id must be integer"}), 400)
+        if not _is_global_admin_requester(role, requester_id):
+            target_supervisor, scope_error = _load_target_user_with_scope(
+                requester,
+                requester_id,
+                supervisor_id,
+                allow_self=True,
+                supervisor_target_roles=('sv', 'supervisor'),
+                not_found_message="Supervisor not found",
+                forbidden_message="Forbidden: supervisor is outside your department"
+            )
+            if scope_error:
+                message, status_code = scope_error
+                return None, (jsonify({"error": message}), status_code)
+            if _normalize_user_role(target_supervisor[3]) != 'sv':
+                return None, (jsonify({"error": "Supervisor not found"}), 404)
 
-        # Перешедший оператор показывается ОДНОЙ строкой (не дробим на под-строки «ФИО · Группа»).
-        # В отчёте ПО ГРУППЕ (group_id задан) билдер берёт дни оператора в ЭТОЙ группе из
-        # group_segments и показывает по ним данные, а дни, когда он был в ДРУГОЙ группе, помечает
-        # «др.» и не учитывает в итогах — поэтому метрики разных моделей не смешиваются и не
-        # пропадают (в каждой группе виден свой сегмент). В отчёте по СВ/общем (group_id нет) —
-        # одна строка с полным месяцем, как раньше (legacy).
+    return dict(
+        month=month,
+        supervisor_id=supervisor_id,
+        group_id=group_id,
+        generate_all=generate_all,
+        requester_id=requester_id,
+        effective_role=effective_role,
+        scope_department_id=scope_department_id,
+        department_id=None if _is_global_admin_requester(role, requester_id) else scope_department_id,
+    ), None
 
-        try:
-            if generate_all:
-                trainings_list_raw = db.get_trainings(None, month)
-            else:
-                trainings_list_raw = db.get_trainings(supervisor_id, month)
-        except Exception as e:
-            logging.exception("Ошибка получения trainings из db")
-            trainings_list_raw = []
 
-        try:
-            y, m = map(int, month.split('-'))
-            month_last_day = calendar.monthrange(y, m)[1]
-            date_from = f"{month}-01"
-            date_to = f"{month}-{str(month_last_day).zfill(2)}"
-            technical_result = db.get_operator_technical_issues(
-                requester_id=requester_id,
-                requester_role=effective_role,
-                date_from=date_from,
-                date_to=date_to,
-                limit=5000,
-                offset=0,
-                scope_department_id=scope_department_id
-            )
-            technical_items_raw = technical_result.get('items', []) if isinstance(technical_result, dict) else []
-        except Exception:
-            logging.exception("Ошибка получения technical issues из db")
-            technical_items_raw = []
+def _monthly_hours_report_write(scope, output):
+    """Собрать отчёт «Учёта часов» по scope (см. _monthly_hours_report_scope) в output.
 
-        visible_operator_ids = set()
-        try:
-            operators_list_for_scope = operators.get("operators", []) if isinstance(operators, dict) else []
-            visible_operator_ids = {
-                int(op.get("operator_id"))
-                for op in operators_list_for_scope
-                if op and op.get("operator_id") is not None
-            }
-        except Exception:
-            visible_operator_ids = set()
+    Возвращает имя файла. Ошибка получения операторов пробрасывается: пустой отчёт
+    вместо ошибки прочитался бы как месяц без часов."""
+    month = scope['month']
+    supervisor_id = scope['supervisor_id']
+    group_id = scope['group_id']
+    generate_all = scope['generate_all']
+    requester_id = scope['requester_id']
+    effective_role = scope['effective_role']
+    scope_department_id = scope['scope_department_id']
 
-        if visible_operator_ids:
-            trainings_list = [
-                item for item in trainings_list_raw
-                if int(item.get("operator_id") or 0) in visible_operator_ids
-            ]
-            technical_items = []
-            for item in technical_items_raw:
-                try:
-                    if int(item.get("operator_id")) in visible_operator_ids:
-                        technical_items.append(item)
-                except Exception:
-                    continue
-        else:
-            trainings_list = trainings_list_raw if generate_all else []
-            technical_items = technical_items_raw if generate_all else []
+    logging.info("Начало генерации отчета: supervisor_id=%s group_id=%s month=%s generate_all=%s", supervisor_id, group_id, month, generate_all)
 
-        trainings_map = build_trainings_map(trainings_list)
-        technical_issues_map = build_technical_issues_map(technical_items)
+    try:
+        if generate_all:
+            operators = db.get_daily_hours_for_all_month(month, department_id=scope['department_id'])
+        elif group_id is not None:
+            operators = db.get_daily_hours_by_group_month(group_id, month)
+        else:
+            operators = db.get_daily_hours_by_supervisor_month(supervisor_id, month)
+    except Exception:
+        logging.exception("Ошибка получения operators из db")
+        raise
 
-        try:
-            y, m = map(int, month.split('-'))
-            month_last_day = calendar.monthrange(y, m)[1]
-            date_from = f"{month}-01"
-            date_to = f"{month}-{str(month_last_day).zfill(2)}"
-            offline_result = db.get_operator_offline_activities(
-                requester_id=requester_id,
-                requester_role=effective_role,
-                date_from=date_from,
-                date_to=date_to,
-                supervisor_id=supervisor_id if not generate_all else None,
-                limit=5000,
-                offset=0,
-                scope_department_id=scope_department_id
-            )
-            offline_items_raw = offline_result.get('items', []) if isinstance(offline_result, dict) else []
-        except Exception:
-            logging.exception("Ошибка получения offline activities из db")
-            offline_items_raw = []
+    # Перешедший оператор показывается ОДНОЙ строкой (не дробим на под-строки «ФИО · Группа»).
+    # В отчёте ПО ГРУППЕ (group_id задан) билдер берёт дни оператора в ЭТОЙ группе из
+    # group_segments и показывает по ним данные, а дни, когда он был в ДРУГОЙ группе, помечает
+    # «др.» и не учитывает в итогах — поэтому метрики разных моделей не смешиваются и не
+    # пропадают (в каждой группе виден свой сегмент). В отчёте по СВ/общем (group_id нет) —
+    # одна строка с полным месяцем, как раньше (legacy).
 
-        if visible_operator_ids:
-            offline_items = []
-            for item in offline_items_raw:
-                try:
-                    if int(item.get("operator_id")) in visible_operator_ids:
-                        offline_items.append(item)
-                except Exception:
-                    continue
+    try:
+        if generate_all:
+            trainings_list_raw = db.get_trainings(None, month)
         else:
-            offline_items = offline_items_raw if generate_all else []
+            trainings_list_raw = db.get_trainings(supervisor_id, month)
+    except Exception as e:
+        logging.exception("Ошибка получения trainings из db")
+        trainings_list_raw = []
 
-        offline_activities_map = build_offline_activities_map(offline_items)
-        try:
-            operators_list_for_practice = operators.get("operators", []) if isinstance(operators, dict) else []
-            for op in operators_list_for_practice:
+    try:
+        y, m = map(int, month.split('-'))
+        month_last_day = calendar.monthrange(y, m)[1]
+        date_from = f"{month}-01"
+        date_to = f"{month}-{str(month_last_day).zfill(2)}"
+        technical_result = db.get_operator_technical_issues(
+            requester_id=requester_id,
+            requester_role=effective_role,
+            date_from=date_from,
+            date_to=date_to,
+            limit=5000,
+            offset=0,
+            scope_department_id=scope_department_id
+        )
+        technical_items_raw = technical_result.get('items', []) if isinstance(technical_result, dict) else []
+    except Exception:
+        logging.exception("Ошибка получения technical issues из db")
+        technical_items_raw = []
+
+    visible_operator_ids = set()
+    try:
+        operators_list_for_scope = operators.get("operators", []) if isinstance(operators, dict) else []
+        visible_operator_ids = {
+            int(op.get("operator_id"))
+            for op in operators_list_for_scope
+            if op and op.get("operator_id") is not None
+        }
+    except Exception:
+        visible_operator_ids = set()
+
+    if visible_operator_ids:
+        trainings_list = [
+            item for item in trainings_list_raw
+            if int(item.get("operator_id") or 0) in visible_operator_ids
+        ]
+        technical_items = []
+        for item in technical_items_raw:
+            try:
+                if int(item.get("operator_id")) in visible_operator_ids:
+                    technical_items.append(item)
+            except Exception:
+                continue
+    else:
+        trainings_list = trainings_list_raw if generate_all else []
+        technical_items = technical_items_raw if generate_all else []
+
+    trainings_map = build_trainings_map(trainings_list)
+    technical_issues_map = build_technical_issues_map(technical_items)
+
+    try:
+        y, m = map(int, month.split('-'))
+        month_last_day = calendar.monthrange(y, m)[1]
+        date_from = f"{month}-01"
+        date_to = f"{month}-{str(month_last_day).zfill(2)}"
+        offline_result = db.get_operator_offline_activities(
+            requester_id=requester_id,
+            requester_role=effective_role,
+            date_from=date_from,
+            date_to=date_to,
+            supervisor_id=supervisor_id if not generate_all else None,
+            limit=5000,
+            offset=0,
+            scope_department_id=scope_department_id
+        )
+        offline_items_raw = offline_result.get('items', []) if isinstance(offline_result, dict) else []
+    except Exception:
+        logging.exception("Ошибка получения offline activities из db")
+        offline_items_raw = []
+
+    if visible_operator_ids:
+        offline_items = []
+        for item in offline_items_raw:
+            try:
+                if int(item.get("operator_id")) in visible_operator_ids:
+                    offline_items.append(item)
+            except Exception:
+                continue
+    else:
+        offline_items = offline_items_raw if generate_all else []
+
+    offline_activities_map = build_offline_activities_map(offline_items)
+    try:
+        operators_list_for_practice = operators.get("operators", []) if isinstance(operators, dict) else []
+        for op in operators_list_for_practice:
+            try:
+                op_id = int(op.get("operator_id"))
+            except Exception:
+                continue
+            by_day = op.get("offline_activities_by_day") if isinstance(op, dict) else None
+            if not isinstance(by_day, dict):
+                continue
+            for day_key, day_items in by_day.items():
                 try:
-                    op_id = int(op.get("operator_id"))
+                    day_num = int(day_key)
                 except Exception:
                     continue
-                by_day = op.get("offline_activities_by_day") if isinstance(op, dict) else None
-                if not isinstance(by_day, dict):
-                    continue
-                for day_key, day_items in by_day.items():
-                    try:
-                        day_num = int(day_key)
-                    except Exception:
+                for item in (day_items if isinstance(day_items, list) else []):
+                    if not isinstance(item, dict):
                         continue
-                    for item in (day_items if isinstance(day_items, list) else []):
-                        if not isinstance(item, dict):
-                            continue
-                        is_practice_shift = (
-                            item.get("source") == "work_shift"
-                            or item.get("shift_type") == "office_practice"
-                            or item.get("is_practice_shift") is True
-                        )
-                        if not is_practice_shift:
-                            continue
-                        offline_activities_map.setdefault(op_id, {}).setdefault(day_num, []).append(item)
+                    is_practice_shift = (
+                        item.get("source") == "work_shift"
+                        or item.get("shift_type") == "office_practice"
+                        or item.get("is_practice_shift") is True
+                    )
+                    if not is_practice_shift:
+                        continue
+                    offline_activities_map.setdefault(op_id, {}).setdefault(day_num, []).append(item)
+    except Exception:
+        logging.exception("Ошибка добавления практики в офисе в offline activities map")
+
+    if generate_all:
+        filename, _ = db.generate_excel_report_all_operators_from_view(
+            operators,
+            trainings_map,
+            technical_issues_map,
+            month,
+            offline_activities_map=offline_activities_map,
+            output=output
+        )
+    else:
+        filename, _ = db.generate_excel_report_from_view(
+            operators,
+            trainings_map,
+            technical_issues_map,
+            month,
+            offline_activities_map=offline_activities_map,
+            report_group_id=group_id,
+            output=output
+        )
+    return filename
+
+
+@app.route('/api/report/monthly_hours', methods=['GET'])
+@require_api_key
+def get_monthly_report_hours():
+    try:
+        scope, scope_error = _monthly_hours_report_scope()
+        if scope_error:
+            return scope_error
+
+        report_file = tempfile.SpooledTemporaryFile(max_size=MONTHLY_HOURS_REPORT_SPOOL_BYTES)
+        try:
+            filename = _monthly_hours_report_write(scope, report_file)
+            size = report_file.seek(0, os.SEEK_END)
+            report_file.seek(0)
         except Exception:
-            logging.exception("Ошибка добавления практики в офисе в offline activities map")
+            report_file.close()
+            raise
 
-        if generate_all:
-            filename, content = db.generate_excel_report_all_operators_from_view(
-                operators,
-                trainings_map,
-                technical_issues_map,
-                month,
-                offline_activities_map=offline_activities_map
-            )
-        else:
-            filename, content = db.generate_excel_report_from_view(
-                operators,
-                trainings_map,
-                technical_issues_map,
-                month,
-                offline_activities_map=offline_activities_map,
-                report_group_id=group_id
-            )
-            
-        if not filename or not content:
+        if not filename or not size:
+            report_file.close()
             logging.error("Генерация отчёта вернула пустой результат")
             return jsonify({"error": "Failed to generate report"}), 500
 
+        # Файл закроет (и удалит) сам ответ, дочитав его до конца.
         return send_file(
-            BytesIO(content),
+            report_file,
             as_attachment=True,
             download_name=filename,
             mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
@@ -24667,6 +25338,203 @@ def get_monthly_report_hours():
         return jsonify({"error": f"Internal server error"}), 500
 
 
+export_jobs.register(export_jobs.ExportKind(
+    'monthly_hours',
+    # Сутками здесь резать нечего: операторы месяца читаются одной выборкой, а файл
+    # пишется потоково (xlsx_stream). Задача снимает с нити waitress саму сборку.
+    build=lambda params, chunks, output, context: _monthly_hours_report_write(params, output),
+))
+
+
+@app.route('/api/report/monthly_hours/jobs', methods=['POST'])
+@require_api_key
+def create_monthly_report_hours_job():
+    """Отчёт «Учёта часов» фоновой задачей: те же параметры и права, что у GET-ручки."""
+    try:
+        scope, scope_error = _monthly_hours_report_scope()
+        if scope_error:
+            return scope_error
+        return _export_job_enqueue_response('monthly_hours', scope['requester_id'], scope)
+    except Exception:
+        logging.exception("Error queueing monthly report")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+# === Фоновые выгрузки (export_jobs) =============================================================
+# Очередь, воркеры и чекпоинты — в export_jobs.py; здесь хранилище результата и ручки статуса.
+# Ручки постановки живут рядом со своими выгрузками (…/jobs) и отвечают 202 с задачей.
+# Воркеры — свои нити, не нити waitress, и их немного: выгрузки упираются в квоты источников
+# (Chat2Desk, Oktell), а не в процессор.
+EXPORT_JOB_WORKERS = _env_int('EXPORT_JOB_WORKERS', 2, minimum=1, maximum=8)
+EXPORT_JOB_POLL_SECONDS = _env_int('EXPORT_JOB_POLL_SECONDS', 5, minimum=1, maximum=60)
+# Задача, чей воркер молчит дольше этого, считается брошенной (рестарт, падение процесса)
+# и выдаётся снова — с чекпоинта, не больше EXPORT_JOB_MAX_ATTEMPTS заходов.
+EXPORT_JOB_STALE_SECONDS = _env_int('EXPORT_JOB_STALE_SECONDS', 600, minimum=60, maximum=7200)
+EXPORT_JOB_MAX_ATTEMPTS = _env_int('EXPORT_JOB_MAX_ATTEMPTS', 3, minimum=1, maximum=10)
+# Пауза перед повтором упавшей задачи: удваивается с каждой попыткой, но не больше потолка.
+EXPORT_JOB_RETRY_SECONDS = _env_int('EXPORT_JOB_RETRY_SECONDS', 30, minimum=0, maximum=3600)
+EXPORT_JOB_RETRY_MAX_SECONDS = _env_int('EXPORT_JOB_RETRY_MAX_SECONDS', 900, minimum=0, maximum=86400)
+EXPORT_JOB_DOWNLOAD_URL_TTL_SECONDS = _env_int(
+    'EXPORT_JOB_DOWNLOAD_URL_TTL_SECONDS', 900, minimum=60, maximum=86400)
+# SSE прогресса: воркеры этого процесса будят поток сразу; опрос — на случай воркера в другом.
+EXPORT_JOB_EVENT_POLL_SECONDS = 3
+EXPORT_JOB_EVENT_HEARTBEAT_SECONDS = 15
+
+
+def _export_job_bucket_name():
+    return (
+        (os.getenv('GOOGLE_CLOUD_STORAGE_BUCKET_EXPORTS') or '').strip()
+        or (os.getenv('GOOGLE_CLOUD_STORAGE_BUCKET_TASKS') or '').strip()
+        or (os.getenv('GOOGLE_CLOUD_STORAGE_BUCKET') or '').strip()
+    )
+
+
+def _export_job_upload(job, file_name, fileobj, content_type):
+    bucket_name = _export_job_bucket_name()
+    if not bucket_name:
+        raise RuntimeError("Хранилище выгрузок не настроено: GOOGLE_CLOUD_STORAGE_BUCKET_EXPORTS не задан")
+    blob_path = f"exports/{job['kind']}/{job['id']}/{secure_filename(file_name) or 'export.xlsx'}"
+    blob = get_gcs_client().bucket(bucket_name).blob(blob_path)
+    blob.upload_from_file(fileobj, content_type=content_type, rewind=True)
+    return bucket_name, blob_path
+
+
+export_job_workers = export_jobs.ExportJobWorkers(
+    db,
+    _export_job_upload,
+    workers=EXPORT_JOB_WORKERS,
+    poll_seconds=EXPORT_JOB_POLL_SECONDS,
+    stale_seconds=EXPORT_JOB_STALE_SECONDS,
+    max_attempts=EXPORT_JOB_MAX_ATTEMPTS,
+    retry_seconds=EXPORT_JOB_RETRY_SECONDS,
+    retry_max_seconds=EXPORT_JOB_RETRY_MAX_SECONDS,
+)
+
+
+def _export_job_payload(job, with_download=False):
+    """Задача для клиента: без пути в хранилище, со ссылкой на файл, когда он готов."""
+    payload = {
+        key: job.get(key)
+        for key in (
+            'id', 'kind', 'status', 'progress_done', 'progress_total', 'attempts', 'error',
+            'file_name', 'result_size', 'created_at', 'started_at', 'finished_at',
+        )
+    }
+    payload['download_url'] = None
+    if with_download and job.get('status') == export_jobs.STATUS_DONE and job.get('result_blob_path'):
+        try:
+            blob = get_gcs_client().bucket(job['result_bucket']).blob(job['result_blob_path'])
+            payload['download_url'] = blob.generate_signed_url(
+                version="v4",
+                expiration=timedelta(seconds=EXPORT_JOB_DOWNLOAD_URL_TTL_SECONDS),
+                method="GET",
+                response_disposition=f'attachment; filename="{job.get("file_name") or "export.xlsx"}"',
+            )
+        except Exception as error:
+            logging.warning("Фоновые выгрузки: ссылка на файл задачи %s не подписалась: %s", job.get('id'), error)
+    return payload
+
+
+def _export_job_enqueue_response(kind, requester_id, params):
+    try:
+        job = db.create_export_job(kind, int(requester_id), params)
+    except Exception:
+        logging.exception("Фоновые выгрузки: задача %s не встала в очередь", kind)
+        return jsonify({"error": "Не удалось поставить выгрузку в очередь"}), 500
+    export_job_workers.start()
+    export_job_workers.wake()
+    return jsonify({"status": "success", "job": _export_job_payload(job)}), 202
+
+
+def _export_job_for_requester(job_id):
+    """(job, None) или (None, (ответ, статус)). Чужую задачу видит только глобальный админ."""
+    requester_id, requester, auth_error = _get_authenticated_requester()
+    if auth_error:
+        message, status_code = auth_error
+        return None, (jsonify({"error": message}), status_code)
+    job = db.get_export_job(job_id)
+    if job and job.get('requester_id') != requester_id:
+        if not _is_global_admin_requester(_normalize_user_role(requester[3]), requester_id):
+            job = None
+    if not job:
+        return None, (jsonify({"error": "Выгрузка не найдена"}), 404)
+    return job, None
+
+
+@app.route('/api/export_jobs', methods=['GET', 'OPTIONS'])
+@require_api_key
+def api_export_jobs():
+    """Последние фоновые выгрузки пользователя."""
+    if request.method == 'OPTIONS':
+        return _build_cors_preflight_response()
+    requester_id, requester, auth_error = _get_authenticated_requester()
+    if auth_error:
+        message, status_code = auth_error
+        return jsonify({"error": message}), status_code
+    try:
+        jobs = db.list_export_jobs(requester_id, limit=request.args.get('limit', type=int) or 20)
+        return jsonify({"status": "success", "jobs": [_export_job_payload(job) for job in jobs]}), 200
+    except Exception as error:
+        logging.error(f"Export jobs list error: {error}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route('/api/export_jobs/<int:job_id>', methods=['GET', 'OPTIONS'])
+@require_api_key
+def api_export_job(job_id):
+    """Статус задачи; у готовой — подписанная ссылка на файл."""
+    if request.method == 'OPTIONS':
+        return _build_cors_preflight_response()
+    try:
+        job, job_error = _export_job_for_requester(job_id)
+        if job_error:
+            return job_error
+        return jsonify({"status": "success", "job": _export_job_payload(job, with_download=True)}), 200
+    except Exception as error:
+        logging.error(f"Export job status error: {error}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route('/api/export_jobs/<int:job_id>/events', methods=['GET', 'OPTIONS'])
+@require_api_key
+def api_export_job_events(job_id):
+    """Прогресс задачи потоком SSE: событие `job` на каждое изменение, последнее — с ссылкой."""
+    if request.method == 'OPTIONS':
+        return _build_cors_preflight_response()
+    job, job_error = _export_job_for_requester(job_id)
+    if job_error:
+        return job_error
+
+    @stream_with_context
+    def generate():
+        current = job
+        last_state = None
+        signal_id = export_jobs.current_signal()
+        heartbeat_at = time.time()
+        yield f": connected {int(heartbeat_at)}\n\n"
+        while True:
+            state = (current['status'], current['progress_done'], current['progress_total'])
+            finished = current['status'] in export_jobs.TERMINAL_STATUSES
+            if state != last_state:
+                last_state = state
+                data = json.dumps(_export_job_payload(current, with_download=finished), ensure_ascii=False)
+                yield "event: job\n"
+                yield f"data: {data}\n\n"
+                heartbeat_at = time.time()
+            if finished:
+                return
+            signal_id = export_jobs.wait_for_signal(signal_id, EXPORT_JOB_EVENT_POLL_SECONDS)
+            if time.time() - heartbeat_at >= EXPORT_JOB_EVENT_HEARTBEAT_SECONDS:
+                yield f": heartbeat {int(time.time())}\n\n"
+                heartbeat_at = time.time()
+            current = db.get_export_job(job_id) or {**current, 'status': export_jobs.STATUS_FAILED}
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @app.route('/api/trainings', methods=['GET'])
 @require_api_key
 def get_trainings():
@@ -29296,6 +30164,13 @@ CHAT2DESK_STATISTICS_REPORT_OPERATOR_STATS = 'operator_stats'
 CHAT2DESK_STATISTICS_REPORT_OPERATOR_EVENTS = 'operator_events'
 
 
+# Chat2Desk считает запросы API в квоту тарифа и на превышение отвечает 429. Сессия
+# общего слоя интеграций держит соединение с api-02 между страницами выгрузки, на 429
+# ставит Chat2Desk на паузу для всех нитей, а остаток квоты показывает в
+# /api/admin/http_clients/stats.
+_chat2desk_session = http_clients.session('chat2desk')
+
+
 def _chat2desk_api_token():
     token = (os.getenv('CHAT2DESK_API_TOKEN') or CHAT2DESK_API_TOKEN or '').strip()
     if not token:
@@ -29500,7 +30375,7 @@ def _chat2desk_statistics_get(report, day_str, max_pages=None):
             'limit': limit,
             'offset': offset,
         }
-        response = requests.get(url, headers=headers, params=params, timeout=timeout)
+        response = _chat2desk_session.get(url, headers=headers, params=params, timeout=timeout)
         if response.status_code >= 400:
             raise RuntimeError(_chat2desk_api_error_message(response, report, day_str))
         try:
@@ -29556,7 +30431,7 @@ def _chat2desk_operator_by_id(operator_id):
     timeout = _env_int('CHAT2DESK_API_TIMEOUT_SECONDS', CHAT2DESK_API_TIMEOUT_SECONDS, minimum=5, maximum=300)
     url = f"{_chat2desk_api_base_url()}/v1/operators/{operator_key}"
     try:
-        response = requests.get(
+        response = _chat2desk_session.get(
             url,
             headers={'Authorization': authorization, 'Accept': 'application/json'},
             timeout=timeout
@@ -30300,13 +31175,11 @@ def _oktell_operator_model_gate(range_from, range_to, operator_ids):
 # сервер закрывал через ~5 с, после нашей просьбы поднять --timeout-keep-alive — через ~60 с,
 # то есть при опросе табло раз в 15 с соединение живёт постоянно. Пул держим маленьким
 # намеренно: прокси низкоконкурентный, запросы у нас последовательные, и пул не должен
-# провоцировать обратное.
+# провоцировать обратное. Сессия собирается общим слоем интеграций (http_clients): он же
+# считает задержки и ошибки прокси. Своих повторов слою не даём — единственный повтор по
+# протухшему keep-alive делает _oktell_proxy_query.
 def _build_oktell_session():
-    session = requests.Session()
-    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-    return session
+    return http_clients.session('oktell', pool_connections=1, pool_maxsize=4, retries=0)
 
 
 _oktell_session = _build_oktell_session()
@@ -30341,9 +31214,11 @@ def _oktell_dropped_keepalive(exc):
     return False
 
 
-def _oktell_query(sql, timeout=None):
+def _oktell_proxy_query(sql, timeout=None):
     """Один read-only SELECT к прокси Oktell. Возвращает список dict (rows).
 
+    Напрямую не зовётся: все потребители идут через _oktell_query (шлюз oktell_gateway).
+
     timeout — переопределение общего OKTELL_API_TIMEOUT_SECONDS для ОЖИДАНИЯ ОТВЕТА. Нужно
     интерактивным потребителям (табло): экрану лучше быстро сдаться и показать предыдущий
     снимок, чем ждать минуту. Установка соединения ограничена отдельно и всегда коротко."""
@@ -30370,6 +31245,32 @@ def _oktell_query(sql, timeout=None):
     return payload.get('rows') or []
 
 
+def _oktell_today():
+    return datetime.now(ZoneInfo(OKTELL_SYNC_TIMEZONE)).date()
+
+
+# Общий шлюз к прокси (см. oktell_gateway.py): одинаковые SELECT склеиваются, ответы за
+# закрытые сутки кэшируются, в прокси одновременно не больше OKTELL_GATEWAY_MAX_CONCURRENCY
+# запросов, и табло получает слот раньше отчётов и синков.
+_oktell_gateway = oktell_gateway.OktellGateway(
+    _oktell_proxy_query,
+    max_concurrency=OKTELL_GATEWAY_MAX_CONCURRENCY,
+    cache_ttl_seconds=OKTELL_GATEWAY_CLOSED_DAY_TTL_SECONDS,
+    cache_max_rows=OKTELL_GATEWAY_CACHE_MAX_ROWS,
+    today=_oktell_today,
+)
+
+
+def _oktell_query(sql, timeout=None, *, priority=None, closed_day=None):
+    """SELECT к Oktell через общий шлюз.
+
+    priority — oktell_gateway.PRIORITY_*; по умолчанию запрос из HTTP-ручки интерактивный,
+    из фоновой нити — синк. closed_day — последний день, который покрывает запрос: если он
+    уже закрыт, ответ можно отдать из кэша. Синки closed_day не передают — им нужны свежие
+    данные, ради этого они и запускаются."""
+    return _oktell_gateway.query(sql, timeout, priority=priority, closed_day=closed_day)
+
+
 def _oktell_status_page_sql(date_from_compact, date_to_excl_compact, cursor):
     # Один SELECT, keyset по Enumerator. Прокси режет на 1000 строк -> листаем по курсору.
     return (
@@ -30961,7 +31862,8 @@ def sync_oktell_resource_hours(day=None, date_from=None, date_to=None, triggered
 # потерянные). Потерянные из знаменателя не выкидываем: не дождавшийся абонент — это тоже
 # нарушенный уровень сервиса. Сбросы на приветствии в очередь не попадают (LenQueue = NULL)
 # и в знаменатель не идут.
-# Ничего не сохраняем: каждый запрос UI считается напрямую в Oktell.
+# Закрытые сутки берутся из локального кэша oktell_billing_days (см. _oktell_billing_days_rows),
+# сегодняшние всегда считаются в Oktell.
 OKTELL_BILLING_SL_DEFAULT_SECONDS = int(os.getenv('OKTELL_BILLING_SL_SECONDS', '20'))
 
 _OKTELL_BILLING_METRICS = (
@@ -31031,33 +31933,126 @@ def _oktell_billing_sql(date_from_compact, date_to_excl_compact, minute_from, mi
     )
 
 
-def _oktell_fetch_billing_rows(range_from, range_to, minute_from, minute_to, sl_seconds, group_by='park'):
-    """Строки (день x таксопарк [x линия]) за период. Окна по OKTELL_RESOURCE_CHUNK_DAYS дней;
-    при упоре в лимит прокси (1000 строк) — по одному дню. Запросы строго последовательные."""
+def _oktell_billing_fetch_windows(range_from, range_to, fetch):
+    """Строки за период окнами по OKTELL_RESOURCE_CHUNK_DAYS дней; окно, упёршееся в лимит прокси
+    (1000 строк), перезапрашивается по одному дню. fetch(a, b) -> строки за [a, b].
+    Запросы строго последовательные."""
     rows = []
-
-    def _window(a, b):
-        page = _oktell_query(_oktell_billing_sql(
-            a.strftime('%Y%m%d'), (b + timedelta(days=1)).strftime('%Y%m%d'),
-            minute_from, minute_to, sl_seconds, group_by))
-        if len(page) >= OKTELL_API_PAGE_SIZE and a < b:
-            d = a
-            while d <= b:
-                rows.extend(_oktell_query(_oktell_billing_sql(
-                    d.strftime('%Y%m%d'), (d + timedelta(days=1)).strftime('%Y%m%d'),
-                    minute_from, minute_to, sl_seconds, group_by)))
-                d += timedelta(days=1)
-        else:
-            rows.extend(page)
-
     cur = range_from
     while cur <= range_to:
         chunk_end = min(range_to, cur + timedelta(days=OKTELL_RESOURCE_CHUNK_DAYS - 1))
-        _window(cur, chunk_end)
+        page = fetch(cur, chunk_end)
+        if len(page) >= OKTELL_API_PAGE_SIZE and cur < chunk_end:
+            d = cur
+            while d <= chunk_end:
+                rows.extend(fetch(d, d))
+                d += timedelta(days=1)
+        else:
+            rows.extend(page)
         cur = chunk_end + timedelta(days=1)
     return rows
 
 
+# --- «Биллинг Oktell»: кэш закрытых суток ---------------------------------------------------------
+# Прошедшие сутки в Oktell не меняются, а месячный отчёт каждый раз заново агрегировал на прокси
+# весь месяц. Агрегаты закрытых суток (ровно той зернистости, что отдаёт SQL) лежат в
+# oktell_billing_days, и отчёт за месяц — это чтение из PostgreSQL плюс живой запрос за сегодня
+# и за сутки, которых в кэше ещё нет (их досчитываем и сохраняем).
+# Версия формулы — по виду: поднимать при ЛЮБОЙ правке SQL этого вида, иначе кэш отдаст суммы,
+# посчитанные по-старому. Строки другой версии не читаются и перезаписываются при следующем
+# запросе. Состояния операторов сразу во второй версии: до 2026-08-06 коды 9/10 («Готов» и
+# «Перерыв») были перепутаны, и суммы, посчитанные той формулой, сюда попадать не должны.
+OKTELL_BILLING_DAY_CACHE_ENABLED = _env_bool('OKTELL_BILLING_DAY_CACHE_ENABLED', True)
+# Сколько последних закрытых суток всё равно читать живьём (если в Oktell сутки дописываются
+# с задержкой). 0 — вчерашний день уже из кэша.
+OKTELL_BILLING_DAY_CACHE_SETTLE_DAYS = _env_int('OKTELL_BILLING_DAY_CACHE_SETTLE_DAYS', 0, minimum=0, maximum=7)
+OKTELL_BILLING_FORMULA_VERSIONS = {
+    'park': 1,
+    'line': 1,
+    'operator_calls': 1,
+    'operator_states': 2,
+}
+
+
+def _oktell_billing_days_rows(kind, variant, range_from, range_to, fetch):
+    """Строки вида kind за [range_from, range_to]. Закрытые сутки — из oktell_billing_days
+    (недостающие досчитываются в Oktell одним окном на каждый непрерывный пробел и
+    сохраняются), открытые — всегда живьём. Кэш недоступен — считаем всё живьём, как раньше.
+
+    variant — всё, что кроме дня меняет суммы (окно минут, порог SL)."""
+    if not OKTELL_BILLING_DAY_CACHE_ENABLED:
+        return _oktell_billing_fetch_windows(range_from, range_to, fetch)
+    version = OKTELL_BILLING_FORMULA_VERSIONS[kind]
+    last_closed = min(range_to, _oktell_today() - timedelta(days=1 + OKTELL_BILLING_DAY_CACHE_SETTLE_DAYS))
+    if last_closed < range_from:
+        return _oktell_billing_fetch_windows(range_from, range_to, fetch)
+    try:
+        by_day = db.get_oktell_billing_days(kind, variant, range_from, last_closed, version)
+    except Exception:
+        logging.exception("Биллинг Oktell: кэш закрытых суток не прочитался, считаем в Oktell")
+        return _oktell_billing_fetch_windows(range_from, range_to, fetch)
+
+    gaps = []
+    day = range_from
+    while day <= last_closed:
+        if day not in by_day:
+            if gaps and gaps[-1][1] == day - timedelta(days=1):
+                gaps[-1][1] = day
+            else:
+                gaps.append([day, day])
+        day += timedelta(days=1)
+
+    extra = []
+    for gap_from, gap_to in gaps:
+        fetched = {}
+        day = gap_from
+        while day <= gap_to:
+            fetched[day] = []
+            day += timedelta(days=1)
+        keys = {d.isoformat(): d for d in fetched}
+        stray = []
+        for row in _oktell_billing_fetch_windows(gap_from, gap_to, fetch):
+            key = keys.get(str(row.get('report_date') or '')[:10])
+            if key is None:
+                stray.append(row)
+            else:
+                fetched[key].append(row)
+        by_day.update(fetched)
+        if stray:
+            # День строки не распознан — такой пробел не кэшируем, строки отдаём как есть.
+            logging.warning("Биллинг Oktell: %s строк %s без дня в периоде %s..%s, сутки не кэшируются",
+                            len(stray), kind, gap_from, gap_to)
+            extra.extend(stray)
+            continue
+        try:
+            db.save_oktell_billing_days(kind, variant, fetched, version)
+        except Exception:
+            logging.exception("Биллинг Oktell: не удалось сохранить закрытые сутки %s..%s", gap_from, gap_to)
+
+    rows = []
+    day = range_from
+    while day <= last_closed:
+        rows.extend(by_day.get(day) or [])
+        day += timedelta(days=1)
+    rows.extend(extra)
+    if last_closed < range_to:
+        rows.extend(_oktell_billing_fetch_windows(last_closed + timedelta(days=1), range_to, fetch))
+    return rows
+
+
+def _oktell_fetch_billing_rows(range_from, range_to, minute_from, minute_to, sl_seconds, group_by='park'):
+    """Строки (день x таксопарк [x линия]) за период: закрытые сутки из кэша, остальное — окнами
+    из Oktell (см. _oktell_billing_fetch_windows)."""
+    def _fetch(a, b):
+        return _oktell_query(_oktell_billing_sql(
+            a.strftime('%Y%m%d'), (b + timedelta(days=1)).strftime('%Y%m%d'),
+            minute_from, minute_to, sl_seconds, group_by), closed_day=b)
+
+    kind = 'line' if group_by == 'line' else 'park'
+    variant = f"{int(minute_from)}-{int(minute_to)}:sl{int(sl_seconds)}"
+    return _oktell_billing_days_rows(kind, variant, range_from, range_to, _fetch)
+
+
 def _oktell_billing_int(value):
     try:
         return int(value or 0)
@@ -31264,7 +32259,7 @@ def _oktell_fetch_billing_detail_page(range_from, range_to, minute_from, minute_
                                       page, per_page, snapshot_id=None):
     return _oktell_query(_oktell_billing_detail_page_sql(
         range_from.strftime('%Y%m%d'), (range_to + timedelta(days=1)).strftime('%Y%m%d'),
-        minute_from, minute_to, page, per_page, snapshot_id))
+        minute_from, minute_to, page, per_page, snapshot_id), closed_day=range_to)
 
 
 def _oktell_fetch_billing_detail_export_rows(range_from, range_to, minute_from, minute_to):
@@ -31277,7 +32272,8 @@ def _oktell_fetch_billing_detail_export_rows(range_from, range_to, minute_from,
     rows = []
     while True:
         raw_page = _oktell_query(_oktell_billing_detail_export_page_sql(
-            date_from, date_to_excl, minute_from, minute_to, max_call_id, page_size))
+            date_from, date_to_excl, minute_from, minute_to, max_call_id, page_size),
+            closed_day=range_to)
         if not raw_page:
             break
         page_ids = [
@@ -31356,31 +32352,21 @@ def _oktell_billing_operator_states_sql(date_from_compact, date_to_excl_compact,
 
 
 def _oktell_fetch_billing_operator_rows(range_from, range_to, minute_from, minute_to):
-    """Пары списков (calls_rows, states_rows) за период; чанки как у паркового отчёта,
-    два последовательных запроса на чанк."""
-    calls_rows = []
-    states_rows = []
-
-    def _window(target, sql_builder, a, b):
-        page = _oktell_query(sql_builder(
-            a.strftime('%Y%m%d'), (b + timedelta(days=1)).strftime('%Y%m%d'),
-            minute_from, minute_to))
-        if len(page) >= OKTELL_API_PAGE_SIZE and a < b:
-            d = a
-            while d <= b:
-                target.extend(_oktell_query(sql_builder(
-                    d.strftime('%Y%m%d'), (d + timedelta(days=1)).strftime('%Y%m%d'),
-                    minute_from, minute_to)))
-                d += timedelta(days=1)
-        else:
-            target.extend(page)
-
-    cur = range_from
-    while cur <= range_to:
-        chunk_end = min(range_to, cur + timedelta(days=OKTELL_RESOURCE_CHUNK_DAYS - 1))
-        _window(calls_rows, _oktell_billing_operator_calls_sql, cur, chunk_end)
-        _window(states_rows, _oktell_billing_operator_states_sql, cur, chunk_end)
-        cur = chunk_end + timedelta(days=1)
+    """Пары списков (calls_rows, states_rows) за период; кэш и окна как у паркового отчёта,
+    у звонков и состояний — свои."""
+    variant = f"{int(minute_from)}-{int(minute_to)}"
+
+    def _fetcher(sql_builder):
+        def _fetch(a, b):
+            return _oktell_query(sql_builder(
+                a.strftime('%Y%m%d'), (b + timedelta(days=1)).strftime('%Y%m%d'),
+                minute_from, minute_to), closed_day=b)
+        return _fetch
+
+    calls_rows = _oktell_billing_days_rows(
+        'operator_calls', variant, range_from, range_to, _fetcher(_oktell_billing_operator_calls_sql))
+    states_rows = _oktell_billing_days_rows(
+        'operator_states', variant, range_from, range_to, _fetcher(_oktell_billing_operator_states_sql))
     return calls_rows, states_rows
 
 
@@ -31999,7 +32985,7 @@ def _szov_wallboard_guard():
     if department_id is not None:
         if _headed_department_id(requester_id) == department_id:
             return requester_id, None
-        if _is_supervisor_role(role) and db.get_user_department_id(requester_id) == department_id:
+        if _is_supervisor_role(role) and _user_department_id(requester_id) == department_id:
             return requester_id, None
     return requester_id, (jsonify({"error": "forbidden"}), 403)
 
@@ -32222,7 +33208,8 @@ def _szov_wallboard_fetch_snapshot():
     """Свежий снимок табло. Ровно ОДИН запрос к Oktell — итоги и статусы приезжают вместе."""
     sl_seconds = int(OKTELL_BILLING_SL_DEFAULT_SECONDS)
     rows = _oktell_query(_oktell_wallboard_snapshot_sql(sl_seconds),
-                         timeout=SZOV_WALLBOARD_OKTELL_TIMEOUT_SECONDS) or []
+                         timeout=SZOV_WALLBOARD_OKTELL_TIMEOUT_SECONDS,
+                         priority=oktell_gateway.PRIORITY_WALLBOARD) or []
     # Итоги дня продублированы в каждой строке — берём из первой. Строка без имени оператора
     # означает «на линии никого»: LEFT JOIN отдал итоги с пустой статусной частью.
     totals = (rows or [{}])[0] or {}
@@ -32313,7 +33300,7 @@ def _szov_wallboard_persist_cache(payload, captured_at):
 
 
 def _wallboard_snapshot_with_cache(*, cache, lock, fetch, source, ttl, stale_max, retry_after,
-                                   lock_wait, before=None, after=None):
+                                   lock_wait, before=None, after=None, shared_key=None):
     """Снимок табло с общим TTL-кэшем на процесс. Одна механика на оба направления.
 
     Табло смотрят несколько человек сразу, и оно висит на стене весь день, поэтому к источнику
@@ -32325,7 +33312,11 @@ def _wallboard_snapshot_with_cache(*, cache, lock, fetch, source, ttl, stale_max
     кэш, но правила устаревания у них обязаны быть одни: разъедутся — и одно табло будет
     показывать замёрзшие данные как свежие. Поэтому копии этой функции быть не должно.
     before/after — то, чем направления отличаются: «Линия» поднимает кэш из БД на старте и
-    дублирует туда удачные снимки."""
+    дублирует туда удачные снимки.
+
+    shared_key — запись в общем кэше процессов (shared_cache). Процессов waitress может
+    быть несколько, и у каждого свой кэш; через общий снимок к источнику на TTL ходит
+    один из них, а пауза после отказа источника тоже одна на всех."""
 
     def _fresh(payload, at):
         return dict(payload, stale=False, age_seconds=int(max(0, time.time() - at)))
@@ -32358,10 +33349,29 @@ def _wallboard_snapshot_with_cache(*, cache, lock, fetch, source, ttl, stale_max
         cached_at = cache['ts']
         if cached is not None and time.time() - cached_at < ttl:
             return _fresh(cached, cached_at)
+        shared = _shared_cache_read(shared_key) if shared_key else None
+        if shared:
+            # Снимок соседнего процесса новее нашего — он и есть наш кэш.
+            if shared.get('payload') is not None and float(shared.get('ts') or 0.0) > cached_at:
+                cache.update(ts=float(shared['ts']), payload=shared['payload'])
+                cached, cached_at = cache['payload'], cache['ts']
+                if time.time() - cached_at < ttl:
+                    return _fresh(cached, cached_at)
+            shared_failed_at = float(shared.get('failed_at') or 0.0)
+            if (cached is not None
+                    and time.time() - shared_failed_at < retry_after
+                    and time.time() - cached_at < stale_max):
+                cache.update(failed_at=shared_failed_at, error=shared.get('error'))
+                return _stale(cached, cached_at, shared.get('error') or f'{source} не отвечает')
         try:
             payload = fetch()
         except Exception as exc:
             cache.update(failed_at=time.time(), error=str(exc)[:200])
+            if shared_key:
+                _shared_cache_write(shared_key, {
+                    'ts': cached_at, 'payload': cached,
+                    'failed_at': cache['failed_at'], 'error': cache['error'],
+                }, stale_max)
             age = time.time() - cached_at if cached is not None else None
             if cached is not None and age is not None and age < stale_max:
                 logging.warning("Табло СЗоВ: %s недоступен, отдаём снимок %.0f с назад: %s",
@@ -32370,6 +33380,8 @@ def _wallboard_snapshot_with_cache(*, cache, lock, fetch, source, ttl, stale_max
             raise
         payload['generated_at'] = datetime.now().isoformat(timespec='seconds')
         cache.update(ts=time.time(), payload=payload, failed_at=0.0, error=None)
+        if shared_key:
+            _shared_cache_write(shared_key, {'ts': cache['ts'], 'payload': payload}, stale_max)
         if after is not None:
             after(payload, cache['ts'])
         return _fresh(payload, cache['ts'])
@@ -32389,7 +33401,8 @@ def _szov_wallboard_snapshot():
         retry_after=SZOV_WALLBOARD_RETRY_AFTER_FAIL_SECONDS,
         lock_wait=SZOV_WALLBOARD_LOCK_WAIT_SECONDS,
         before=_szov_wallboard_restore_cache,
-        after=_szov_wallboard_persist_cache)
+        after=_szov_wallboard_persist_cache,
+        shared_key='szov_wallboard:line')
 
 
 @app.route('/api/szov_wallboard/snapshot', methods=['GET', 'OPTIONS'])
@@ -32513,7 +33526,8 @@ def _oktell_wallboard_hourly_sql(hour_to=None):
 def _szov_broadcast_hourly_rows(hour_to=None):
     """Строки почасовой таблицы. Пустые часы Oktell не отдаёт — их в таблице и не будет."""
     raw = _oktell_query(_oktell_wallboard_hourly_sql(hour_to),
-                        timeout=SZOV_WALLBOARD_OKTELL_TIMEOUT_SECONDS)
+                        timeout=SZOV_WALLBOARD_OKTELL_TIMEOUT_SECONDS,
+                        priority=oktell_gateway.PRIORITY_WALLBOARD)
     rows = []
     for item in raw or []:
         served = _szov_wallboard_int(item.get('served'))
@@ -32781,7 +33795,8 @@ def _szov_break_violations_scan(now=None):
         logging.warning("Перерывы вне графика: состав отдела СЗоВ пуст, разбор пропущен")
         return 0
     raw = _oktell_query(_oktell_break_episodes_sql(window_from, now + timedelta(minutes=1)),
-                        timeout=SZOV_WALLBOARD_OKTELL_TIMEOUT_SECONDS) or []
+                        timeout=SZOV_WALLBOARD_OKTELL_TIMEOUT_SECONDS,
+                        priority=oktell_gateway.PRIORITY_WALLBOARD) or []
     if len(raw) >= OKTELL_API_PAGE_SIZE:
         # Прокси режет ответ по 1000 строк молча. За три часа по всей компании перерывов
         # десятки, так что упереться в потолок можно только раздув окно через env — и тогда
@@ -33602,7 +34617,7 @@ def _chat_hourly_fetch_requests(day_str, *, cache=None):
     offset = 0
     max_pages = _env_int('CHAT2DESK_API_MAX_PAGES', CHAT2DESK_API_MAX_PAGES, minimum=1, maximum=1000)
     for _page in range(max_pages):
-        response = requests.get(url, headers=headers, timeout=timeout, params={
+        response = _chat2desk_session.get(url, headers=headers, timeout=timeout, params={
             'report': CHAT2DESK_STATISTICS_REPORT_REQUEST_STATS,
             'date': day_str,
             'limit': limit,
@@ -33668,7 +34683,7 @@ def _chat_hourly_fetch_operators():
     rows = []
     offset = 0
     for _page in range(20):
-        response = requests.get(
+        response = _chat2desk_session.get(
             f"{_chat2desk_api_base_url()}/v1/operators",
             headers={'Authorization': authorization, 'Accept': 'application/json'},
             params={'limit': 200, 'offset': offset},
@@ -34217,9 +35232,11 @@ SZOV_CHAT_WALLBOARD_ONLINE_MIN_SECONDS = _env_int(
 # два ограничителя: сколько дней разрешено просить за раз и сколько дней тянуть одновременно.
 # Больше 4 потоков смысла нет — узкое место не мы, а квота и скорость самого Chat2Desk.
 # Потолок недели — решение владельца 19.08.2026: месяц — это ~400 запросов и минуты ожидания в
-# одном синхронном запросе, а квота Chat2Desk общая на компанию. Нужен период длиннее — поднять
-# env SZOV_CHAT_EXPORT_MAX_DAYS, но тогда сначала переделать выгрузку на фоновую задачу.
+# одном синхронном запросе, а квота Chat2Desk общая на компанию. Период длиннее идёт фоновой
+# задачей (export_jobs): сутки качаются с чекпоинтами в пуле воркеров выгрузок, нить waitress
+# не ждёт, а клиент смотрит прогресс. Её потолок — SZOV_CHAT_EXPORT_JOB_MAX_DAYS.
 SZOV_CHAT_EXPORT_MAX_DAYS = _env_int('SZOV_CHAT_EXPORT_MAX_DAYS', 7, minimum=1, maximum=92)
+SZOV_CHAT_EXPORT_JOB_MAX_DAYS = _env_int('SZOV_CHAT_EXPORT_JOB_MAX_DAYS', 92, minimum=1, maximum=366)
 SZOV_CHAT_EXPORT_WORKERS = _env_int('SZOV_CHAT_EXPORT_WORKERS', 4, minimum=1, maximum=8)
 
 # Событие статуса Chat2Desk / offline_type -> (ключ, подпись). Оба источника говорят одними и
@@ -34339,7 +35356,7 @@ def _szov_chat_wallboard_fetch_events(day_str, *, cache=None):
     offset = 0
     truncated = True
     for _page in range(SZOV_CHAT_WALLBOARD_EVENT_MAX_PAGES):
-        response = requests.get(url, headers=headers, timeout=timeout, params={
+        response = _chat2desk_session.get(url, headers=headers, timeout=timeout, params={
             'report': CHAT2DESK_STATISTICS_REPORT_OPERATOR_EVENTS,
             'date': day_str,
             'limit': limit,
@@ -34881,7 +35898,8 @@ def _szov_chat_wallboard_snapshot():
         ttl=SZOV_CHAT_WALLBOARD_CACHE_TTL_SECONDS,
         stale_max=SZOV_CHAT_WALLBOARD_STALE_MAX_SECONDS,
         retry_after=SZOV_CHAT_WALLBOARD_RETRY_AFTER_FAIL_SECONDS,
-        lock_wait=SZOV_CHAT_WALLBOARD_LOCK_WAIT_SECONDS)
+        lock_wait=SZOV_CHAT_WALLBOARD_LOCK_WAIT_SECONDS,
+        shared_key='szov_wallboard:chat')
 
 
 @app.route('/api/szov_wallboard/chat_snapshot', methods=['GET', 'OPTIONS'])
@@ -34966,11 +35984,13 @@ def _szov_chat_export_parse_day(value):
         return None
 
 
-def _szov_chat_export_period(date_from, date_to, today):
+def _szov_chat_export_period(date_from, date_to, today, max_days=None):
     """Дни периода по возрастанию. ValueError — если период не разобрался или слишком велик.
 
     Период не выбрали — выгружаем сегодня: это самый частый случай (глянул на табло и забрал
-    цифры), и он не стоит ни одного запроса к Chat2Desk."""
+    цифры), и он не стоит ни одного запроса к Chat2Desk. max_days — потолок фоновой выгрузки;
+    без него действует потолок синхронной."""
+    max_days = max_days or SZOV_CHAT_EXPORT_MAX_DAYS
     start = _szov_chat_export_parse_day(date_from)
     end = _szov_chat_export_parse_day(date_to)
     if date_from and start is None:
@@ -34990,10 +36010,10 @@ def _szov_chat_export_period(date_from, date_to, today):
     if end > today:
         end = today
     length = (end - start).days + 1
-    if length > SZOV_CHAT_EXPORT_MAX_DAYS:
+    if length > max_days:
         # «суток», а не «дней»: число подставляется, а «больше 31 дней» — не по-русски.
         raise ValueError('Период больше %d суток: Chat2Desk качается по дню на день'
-                         % SZOV_CHAT_EXPORT_MAX_DAYS)
+                         % max_days)
     return [(start + timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(length)]
 
 
@@ -35078,6 +36098,34 @@ def _szov_chat_export_past_block(day_str, lookup):
     }, events_truncated=bool(events_cache.get('truncated')), unmatched_names=unmatched)
 
 
+def _szov_chat_export_past_block_or_error(day_str, lookup):
+    """Прошедший день; не дался — строка с причиной, а не исключение на всю выгрузку."""
+    try:
+        return _szov_chat_export_past_block(day_str, lookup)
+    except Exception as exc:
+        # Один день не дался — остальные всё равно нужны: день уходит в файл строкой с
+        # причиной, а не молча нулями, которые прочитаются как простой смены.
+        logging.warning("Табло СЗоВ (чат): день %s не выгрузился: %s", day_str, exc)
+        return _szov_chat_export_finish_day(day_str, [], {}, error=str(exc)[:200])
+
+
+def _szov_chat_export_payload(days, blocks, snapshot, now):
+    """Выгрузка из готовых дней — одна и та же у синхронной ручки и у фоновой задачи."""
+    return {
+        'from': days[0],
+        'to': days[-1],
+        'today': now.strftime('%Y-%m-%d'),
+        'days': [blocks[day] for day in days if day in blocks],
+        'target_seconds': SZOV_CHAT_WALLBOARD_TARGET_SECONDS,
+        'now': (snapshot or {}).get('now'),
+        'chat2desk_now': (snapshot or {}).get('chat2desk_now'),
+        'stale': bool((snapshot or {}).get('stale')),
+        'age_seconds': (snapshot or {}).get('age_seconds'),
+        'error': (snapshot or {}).get('error'),
+        'generated_at': now.strftime('%Y-%m-%d %H:%M'),
+    }
+
+
 def _szov_chat_export_collect(date_from=None, date_to=None):
     """Данные выгрузки: дни периода, а состав смены — только если в период входит сегодня."""
     now = datetime.now(ZoneInfo(CHAT_HOURLY_TIMEZONE))
@@ -35095,14 +36143,7 @@ def _szov_chat_export_collect(date_from=None, date_to=None):
         lookup, _department_id = _szov_chat_wallboard_operator_lookup()
 
         def _one(day_str):
-            try:
-                return day_str, _szov_chat_export_past_block(day_str, lookup)
-            except Exception as exc:
-                # Один день не дался — остальные всё равно нужны: день уходит в файл строкой с
-                # причиной, а не молча нулями, которые прочитаются как простой смены.
-                logging.warning("Табло СЗоВ (чат): день %s не выгрузился: %s", day_str, exc)
-                return day_str, _szov_chat_export_finish_day(day_str, [], {},
-                                                             error=str(exc)[:200])
+            return day_str, _szov_chat_export_past_block_or_error(day_str, lookup)
 
         workers = max(1, min(SZOV_CHAT_EXPORT_WORKERS, len(past_days)))
         with ThreadPoolExecutor(max_workers=workers,
@@ -35110,19 +36151,54 @@ def _szov_chat_export_collect(date_from=None, date_to=None):
             for day_str, block in pool.map(_one, past_days):
                 blocks[day_str] = block
 
-    return {
-        'from': days[0],
-        'to': days[-1],
-        'today': today_str,
-        'days': [blocks[day] for day in days if day in blocks],
-        'target_seconds': SZOV_CHAT_WALLBOARD_TARGET_SECONDS,
-        'now': (snapshot or {}).get('now'),
-        'chat2desk_now': (snapshot or {}).get('chat2desk_now'),
-        'stale': bool((snapshot or {}).get('stale')),
-        'age_seconds': (snapshot or {}).get('age_seconds'),
-        'error': (snapshot or {}).get('error'),
-        'generated_at': now.strftime('%Y-%m-%d %H:%M'),
-    }
+    return _szov_chat_export_payload(days, blocks, snapshot, now)
+
+
+# --- Выгрузка за период фоновой задачей (export_jobs) -------------------------------------------
+# Те же дни, что у синхронной ручки, но каждый прошедший день — чекпоинт задачи: месяц больше
+# не держит нить waitress минутами, а рестарт посреди выгрузки стоит только недокачанных суток.
+# Сегодня считается на момент захода воркера из снимка табло, как и в синхронной выгрузке.
+
+def _szov_chat_export_job_days(params):
+    start = _szov_chat_export_parse_day(params.get('date_from'))
+    end = _szov_chat_export_parse_day(params.get('date_to'))
+    return [(start + timedelta(days=offset)).strftime('%Y-%m-%d')
+            for offset in range((end - start).days + 1)]
+
+
+def _szov_chat_export_job_prepare(params):
+    lookup, _department_id = _szov_chat_wallboard_operator_lookup()
+    return {'lookup': lookup}
+
+
+def _szov_chat_export_job_unit(params, unit, context):
+    now = datetime.now(ZoneInfo(CHAT_HOURLY_TIMEZONE))
+    if unit == now.strftime('%Y-%m-%d'):
+        return _szov_chat_export_today_block(_szov_chat_wallboard_snapshot())
+    # Без «_or_error»: строка «день не выгрузился» ушла бы в чекпоинт, и повтор задачи
+    # её бы уже не пересчитал. Исключение доходит до воркера — сутки досчитает повтор.
+    return _szov_chat_export_past_block(unit, context['lookup'])
+
+
+def _szov_chat_export_job_build(params, chunks, output, context):
+    now = datetime.now(ZoneInfo(CHAT_HOURLY_TIMEZONE))
+    days = _szov_chat_export_job_days(params)
+    blocks = dict(zip(days, chunks))
+    snapshot = _szov_chat_wallboard_snapshot() if now.strftime('%Y-%m-%d') in days else None
+    payload = _szov_chat_export_payload(days, blocks, snapshot, now)
+    output.write(_szov_chat_wallboard_workbook(payload))
+    return _szov_chat_export_file_name(payload)
+
+
+export_jobs.register(export_jobs.ExportKind(
+    'szov_chat',
+    plan=_szov_chat_export_job_days,
+    prepare=_szov_chat_export_job_prepare,
+    run_unit=_szov_chat_export_job_unit,
+    build=_szov_chat_export_job_build,
+    # Тот же ограничитель, что у синхронной выгрузки: узкое место — квота Chat2Desk.
+    unit_workers=SZOV_CHAT_EXPORT_WORKERS,
+))
 
 def _szov_chat_wallboard_workbook(payload):
     """Показатели табло по чатам в .xlsx (bytes).
@@ -35617,6 +36693,33 @@ def api_szov_wallboard_chat_export():
         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
 
 
+@app.route('/api/szov_wallboard/chat_export/jobs', methods=['POST', 'OPTIONS'])
+@require_api_key
+def api_szov_wallboard_chat_export_job():
+    """Табло СЗоВ, направление «Чат»: выгрузка за период фоновой задачей (до
+    SZOV_CHAT_EXPORT_JOB_MAX_DAYS суток). Ответ — задача; файл забирается по её ссылке."""
+    if request.method == 'OPTIONS':
+        return _build_cors_preflight_response()
+    requester_id, err = _szov_wallboard_guard()
+    if err:
+        return err
+    if not _chat2desk_authorization_header():
+        return jsonify({"error": "Интеграция с Chat2Desk недоступна: CHAT2DESK_API_TOKEN не задан"}), 503
+    payload = request.get_json(silent=True) or {}
+    try:
+        days = _szov_chat_export_period(
+            payload.get('date_from') or request.args.get('date_from'),
+            payload.get('date_to') or request.args.get('date_to'),
+            datetime.now(ZoneInfo(CHAT_HOURLY_TIMEZONE)).date(),
+            SZOV_CHAT_EXPORT_JOB_MAX_DAYS)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    return _export_job_enqueue_response('szov_chat', requester_id, {
+        'date_from': days[0],
+        'date_to': days[-1],
+    })
+
+
 # === Отбивка показателей табло, направление «Чат» ==============================================
 # То же, что отбивка «Линии» (см. «Отбивка показателей «Табло СЗоВ» в Telegram»), но своими
 # показателями. Получатели, режимы, аудит, кнопка «Отправить сейчас», обход чатов и правило
@@ -35874,6 +36977,7 @@ async def amo_leads_sync_job():
     """Плановая выгрузка лидов amoCRM — раз в 3 часа."""
     try:
         written = await asyncio.get_event_loop().run_in_executor(executor_pool, amo_leads_sync)
+        scheduler_pools.count_rows(written)
         logging.info("amoCRM: выгрузка лидов завершена, записано сделок: %s", written)
     except Exception as exc:
         logging.error("amoCRM: плановая выгрузка лидов не удалась: %s", exc, exc_info=True)
@@ -42263,10 +43367,16 @@ def import_chat_manager_metrics_csv():
 def run_flask():
     threading.stack_size(2 * 1024 * 1024)
     from waitress import serve
+    # За SSE-шлюзом (SSE_GATEWAY_FRONT) публичный порт у шлюза, waitress — только
+    # на loopback: снаружи до неё доходят лишь запросы, проксированные шлюзом.
+    if SSE_GATEWAY_FRONT:
+        host, port = '127.0.0.1', WAITRESS_INTERNAL_PORT
+    else:
+        host, port = '0.0.0.0', int(os.getenv('PORT', 8080))
     serve(
         app,
-        host='0.0.0.0',
-        port=int(os.getenv('PORT', 8080)),
+        host=host,
+        port=port,
         threads=_env_int('WAITRESS_THREADS', 96, minimum=32, maximum=140),
         connection_limit=_env_int('WAITRESS_CONN_LIMIT', 180, minimum=80, maximum=300),
         channel_timeout=_env_int('WAITRESS_CHANNEL_TIMEOUT', 120, minimum=15, maximum=600),
@@ -52300,6 +53410,9 @@ def _notifications_viewer_context(requester_id, requester):
     }
 
 
+BELL_SUMMARY_CACHE = _env_bool('BELL_SUMMARY_CACHE', True)
+BELL_STREAM_DELTAS = _env_bool('BELL_STREAM_DELTAS', True)
+
 try:
     from notifications.routes import build_notifications_blueprint  # noqa: E402
 
@@ -52314,6 +53427,12 @@ try:
         # (их ~96 на всё): сверх лимита колокол живёт обновлением по фокусу.
         listen_connect=lambda: psycopg2.connect(**_build_postgres_connection_params()),
         stream_limit=_env_int('BELL_STREAM_LIMIT', 50, minimum=10, maximum=120),
+        # Сводка из кеша, который сбрасывают тычки триггеров: перечитка после
+        # тычка пересчитывает один изменившийся источник, а не все восемь.
+        cache_summaries=BELL_SUMMARY_CACHE,
+        # Режим дельт у /stream: клиент, попросивший ?mode=delta, получает
+        # пересчитанные источники прямо в потоке и не перечитывает сводку.
+        stream_deltas=BELL_STREAM_DELTAS,
     ))
     logging.info("Центр уведомлений: Blueprint подключён на /api/notifications")
 except Exception:
@@ -52322,6 +53441,94 @@ except Exception:
     logging.exception("Центр уведомлений: Blueprint НЕ подключён")
 
 
+# ─────────────────────────────────────────────────────────────────────────────
+# SSE-шлюз (sse_gateway.py): те же ленты аукциона и колокола на asyncio-цикле,
+# без нити waitress на каждую вкладку.
+#   SSE_GATEWAY_FRONT=1 — боевой режим: шлюз слушает публичный PORT, waitress
+#     уходит на 127.0.0.1:WAITRESS_INTERNAL_PORT, всё, кроме двух потоков, шлюз
+#     проксирует в неё. Фронту ничего менять не нужно — origin и пути те же.
+#   SSE_GATEWAY_PORT — отдельный порт рядом с waitress (локально, или где его
+#     можно открыть наружу); маршруты выше остаются запасным путём.
+# ─────────────────────────────────────────────────────────────────────────────
+SSE_GATEWAY_FRONT = _env_bool('SSE_GATEWAY_FRONT', False)
+SSE_GATEWAY_PORT = _env_int('SSE_GATEWAY_PORT', 0, minimum=0, maximum=65535)
+WAITRESS_INTERNAL_PORT = _env_int('WAITRESS_INTERNAL_PORT', 8081, minimum=1024, maximum=65535)
+SSE_GATEWAY_MAX_STREAMS = _env_int('SSE_GATEWAY_MAX_STREAMS', 5000, minimum=100, maximum=50000)
+
+
+def _sse_gateway_authorize(stream, method, headers, query_string, remote_addr):
+    """Допуск к потоку шлюза тем же конвейером Flask, что у обычного запроса.
+
+    before_request поднимает пользователя из JWT, require_api_key проверяет куки и
+    ротирует токен, after_request ставит CORS, — поэтому шлюз видит ровно те же
+    401/403 и тот же preflight, что и маршрут waitress, без второй копии правил.
+    """
+    granted = {}
+
+    def _grant():
+        if stream == sse_gateway.STREAM_SHIFT_AUCTION:
+            requester_id, access_error = _shift_auction_events_access()
+        else:
+            requester_id, requester, auth_error = _resolve_requester()
+            access_error = (jsonify({"error": auth_error[0]}), auth_error[1]) if auth_error else None
+            granted['requester'] = requester
+        if access_error:
+            return access_error
+        granted['user_id'] = int(requester_id)
+        return '', 204
+
+    with app.test_request_context(
+        sse_gateway.STREAM_PATHS[stream],
+        method=method,
+        headers=headers,
+        query_string=query_string,
+        environ_base={'REMOTE_ADDR': remote_addr or ''},
+    ):
+        try:
+            response = app.preprocess_request()
+            if response is None:
+                response = require_api_key(_grant)()
+            response = app.process_response(app.make_response(response))
+        finally:
+            app.do_teardown_request()
+    return sse_gateway.AuthVerdict(
+        user_id=granted.get('user_id'),
+        status=response.status_code,
+        headers=list(response.headers.items()),
+        body=response.get_data(),
+        requester=granted.get('requester'),
+    )
+
+
+def _sse_gateway_bell_delta_frame(user_id, requester, changes, limit, seq):
+    """Кадр дельты колокола для шлюза — тем же сборщиком, что у маршрута waitress."""
+    from notifications import realtime as bell_realtime
+    from notifications.routes import delta_frame, make_delta_builder
+
+    def _summary_cache():
+        if not BELL_SUMMARY_CACHE or not bell_realtime.listener_live():
+            return None
+        return bell_realtime.summary_cache
+
+    build = make_delta_builder(db=db, viewer_context=_notifications_viewer_context,
+                               summary_cache=_summary_cache)
+    return delta_frame(build, user_id, requester, changes, limit, seq)
+
+
+sse_event_gateway = sse_gateway.SseGateway(
+    authorize=_sse_gateway_authorize,
+    auction_read=_read_shift_auction_events_from_buffer,
+    auction_catchup=_shift_auction_events_catchup,
+    auction_signal=_get_shift_auction_event_signal_id,
+    auction_wait=_wait_for_shift_auction_event_signal,
+    auction_ensure_listener=_ensure_shift_auction_event_listener_started,
+    bell_listen_connect=lambda: psycopg2.connect(**_build_postgres_connection_params()),
+    bell_delta_frame=_sse_gateway_bell_delta_frame if BELL_STREAM_DELTAS else None,
+    max_streams=SSE_GATEWAY_MAX_STREAMS,
+    upstream=f'http://127.0.0.1:{WAITRESS_INTERNAL_PORT}' if SSE_GATEWAY_FRONT else None,
+)
+
+
 def extract_fio_and_links(spreadsheet_url):
     try:
         match = re.search(r"/d/([a-zA-Z0-9_-]+)", spreadsheet_url)
@@ -53611,6 +54818,28 @@ async def run_user_sessions_retention_async():
         logging.exception("user sessions retention failed")
 
 
+def refresh_ai_qa_trust_rollups():
+    # Досчёт сводок метрик доверия ИИ-оценки: человеческая оценка звонка или чата
+    # часто появляется позже оценки ИИ, а запись сводок на месте её не видит.
+    from call_qa import config as _qa_config
+    from call_qa.review import rollups as _qa_rollups
+    conn = _qa_config.connect_rw()
+    try:
+        refreshed = _qa_rollups.refresh_recent(conn, days=2)
+        scheduler_pools.count_rows(refreshed)
+        return refreshed
+    finally:
+        conn.close()
+
+
+async def run_ai_qa_trust_rollups_async():
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor_pool, refresh_ai_qa_trust_rollups)
+    except Exception:
+        logging.exception("ai-qa trust rollups refresh failed")
+
+
 async def run_wazzup_episodes_async():
     # Ночная сборка эпизодов Wazzup (04:00 Алматы — затишье 02:00–08:00).
     loop = asyncio.get_event_loop()
@@ -53994,6 +55223,7 @@ async def group_late_poll_job():
     """Джоба планировщика: опрос Workpace каждые 2 минуты."""
     try:
         result = await _group_late_poll_cycle()
+        scheduler_pools.count_rows(result.get('fetched'))
         if not result.get('ok'):
             logging.warning("group_late: опрос не удался: %s", result.get('error'))
         elif result.get('events_found'):
@@ -54258,6 +55488,13 @@ if __name__ == '__main__':
     # Запускаем Flask в отдельном потоке
     flask_thread = threading.Thread(target=run_flask, daemon=True)
     flask_thread.start()
+    if SSE_GATEWAY_FRONT:
+        sse_event_gateway.start_in_thread('0.0.0.0', int(os.getenv('PORT', 8080)))
+    elif SSE_GATEWAY_PORT:
+        sse_event_gateway.start_in_thread('0.0.0.0', SSE_GATEWAY_PORT)
+    # Воркеры фоновых выгрузок — сразу, а не по первой постановке: задачи, прерванные
+    # рестартом, должны доехать и без нового клика.
+    export_job_workers.start()
     
     # Настраиваем и запускаем планировщик
     async def monthly_auto_fill_norm():
@@ -54360,6 +55597,7 @@ if __name__ == '__main__':
     scheduler.add_job(
         generate_weekly_report, 
         CronTrigger(day_of_week='mon', hour=9, minute=0),
+        id='weekly_report',
         misfire_grace_time=3600
     )
     scheduler.add_job(
@@ -54375,6 +55613,7 @@ if __name__ == '__main__':
     scheduler.add_job(
         monthly_auto_fill_norm,
         CronTrigger(day='1', hour=3, minute=0),
+        id='monthly_auto_fill_norm',
         misfire_grace_time=3600
     )
 
@@ -54466,6 +55705,16 @@ if __name__ == '__main__':
         coalesce=True
     )
 
+    # Сводки метрик доверия ИИ-оценки — досчёт последних двух дней каждые 30 минут.
+    scheduler.add_job(
+        run_ai_qa_trust_rollups_async,
+        CronTrigger(minute='*/30', timezone=ZoneInfo('Asia/Almaty')),
+        id='ai_qa_trust_rollups',
+        misfire_grace_time=600,
+        max_instances=1,
+        coalesce=True
+    )
+
     # Сборка эпизодов Wazzup (единица ИИ-оценки Верификаторов) — ежедневно
     # в 04:00 (Asia/Almaty), после ретеншна, в суточное затишье трафика.
     scheduler.add_job(
@@ -54804,6 +56053,12 @@ if __name__ == '__main__':
     else:
         logging.warning("⏰ Обзвон фронт-офиса выключен: не задан токен CRM")
 
+    # Каждая джоба — через учёт и пулы своего класса. misfire/coalesce/max_instances
+    # остаются за APScheduler: джобой для него по-прежнему служит обёртка.
+    for _job in scheduler.get_jobs():
+        scheduler.modify_job(_job.id, func=scheduler_job_pools.instrument(
+            _job.id, _job.func, _job.trigger))
+
     scheduler.start()
 
     # Стартовый прогон (не ждём первой минуты)
@@ -19,6 +19,7 @@ from .evaluation import runtime_store
 from .evaluation.fingerprint import (build_evaluation_fingerprint, content_hash,
                                      transcript_fingerprint)
 from .review import queue as review_queue
+from .review import rollups as trust_rollups
 from .review.evidence import (EvidenceValidationError, VALID_VERDICTS,
                               locate_excerpt, validate_evidence)
 
@@ -107,7 +108,15 @@ def direction_in_scope(direction_id, allowed_direction_ids) -> bool:
     return bool(row and row[0] is not None and int(row[0]) in allowed)
 
 
-_QUEUE_FETCH_CAP = 3000  # верх глобальной сортировки по критичности до постраничной нарезки
+# Очередь ревью — один проход по частичному индексу idx_ai_eval_review_queue
+# (model, review_priority, queued_at DESC, subject_kind, call_id): приоритет и момент
+# постановки пишутся в мету при оценке, сортировать на чтении нечего. Страница —
+# limit строк индекса, карточка и субъект подтягиваются только к ним.
+_QUEUE_ORDER = " ORDER BY m.review_priority, m.queued_at DESC, m.subject_kind, m.call_id"
+_QUEUE_AFTER = """ AND (m.review_priority > %s
+                   OR (m.review_priority = %s
+                       AND (m.queued_at < %s
+                            OR (m.queued_at = %s AND (m.subject_kind, m.call_id) > (%s, %s)))))"""
 
 # Один субъект оценки на строку кэша: звонок ИЛИ эпизод чата. Соединения
 # намеренно LEFT + условие по subject_kind — INNER JOIN calls прятал бы эпизоды,
@@ -129,78 +138,102 @@ _SUBJECT_DATETIME = ("COALESCE(TO_CHAR(c.created_at,'DD.MM HH24:MI'),"
                      " TO_CHAR(e.ended_at AT TIME ZONE 'Asia/Almaty','DD.MM HH24:MI'))")
 
 
+def queue_cursor(priority: int, queued_at, subject_kind: str, call_id: int) -> str:
+    """Keyset-курсор позиции в очереди: «priority|queued_at|subject_kind|id»."""
+    return f"{int(priority)}|{queued_at.isoformat()}|{subject_kind}|{int(call_id)}"
+
+
+def parse_queue_cursor(cursor: str) -> tuple:
+    """Обратное к queue_cursor. ValueError — курсор повреждён."""
+    from datetime import datetime
+    try:
+        priority, queued_at, kind, call_id = str(cursor).split("|", 3)
+        return (int(priority), datetime.fromisoformat(queued_at),
+                subjects_mod.normalise_kind(kind), int(call_id))
+    except (TypeError, ValueError) as exc:
+        raise ValueError("некорректный курсор очереди") from exc
+
+
+def _queue_filters(cur, allowed_direction_ids, subject_kind):
+    """Фильтры очереди (scope направлений + тип субъекта). None — scope пуст."""
+    scope_sql, scope_params = "", ()
+    if allowed_direction_ids is not None:
+        family = _scope_family(cur, allowed_direction_ids)
+        if not family:
+            return None
+        scope_sql = f" AND {_SUBJECT_DIRECTION} = ANY(%s)"
+        scope_params = (family,)
+    kind_sql, kind_params = "", ()
+    if subject_kind:
+        kind_sql, kind_params = " AND m.subject_kind = %s", (subjects_mod.normalise_kind(subject_kind),)
+    return scope_sql + kind_sql, scope_params + kind_params
+
+
 def review_queue_list(limit: int = 30, offset: int = 0, allowed_direction_ids=None,
-                      subject_kind=None) -> list[dict]:
+                      subject_kind=None, after: str | None = None) -> list[dict]:
     """Очередь ревью: ИИ-оценённые звонки (текущий тег модели), которые человек ещё не
-    проверял. Причины считаются из сохранённой карточки; сортировка — сначала критичное,
-    внутри — свежее; постранично (limit/offset) поверх глобального порядка. stale=True —
-    сохранённая оценка не совпадает с актуальной конфигурацией (промпт/шкала/база
-    знаний/RAG-режим изменились или immutable-прогона нет); открытие покажет прежнюю
-    оценку с пометкой «устарела», переоценка — только кнопкой «Переоценить» (исключение —
-    карточки без immutable-прогона: их открытие оценит звонок заново). Если миграция меты
-    ещё не прошла — fallback на «последние звонки»."""
+    проверял. Причины и приоритет посчитаны при записи оценки (_meta_upsert); порядок —
+    сначала критичное, внутри — свежее. Постранично: after — keyset-курсор (поле cursor
+    последнего элемента предыдущей страницы), offset оставлен для совместимости.
+    stale=True — сохранённая оценка не совпадает с актуальной конфигурацией
+    (промпт/шкала/база знаний/RAG-режим изменились или immutable-прогона нет); открытие
+    покажет прежнюю оценку с пометкой «устарела», переоценка — только кнопкой
+    «Переоценить» (исключение — карточки без immutable-прогона: их открытие оценит
+    звонок заново). Актуальность зависит от живой конфигурации, поэтому считается на
+    чтении, но только для строк страницы. Если миграция меты ещё не прошла — fallback
+    на «последние звонки»."""
+    keyset = parse_queue_cursor(after) if after else None
     conn = None
     try:
         limit = max(1, min(int(limit), 200)); offset = max(0, int(offset))
         conn = config.connect_ro()
-        cur = conn.cursor(); cur.execute("SET client_encoding TO 'UTF8'")
-        scope_sql, scope_params = "", ()
-        if allowed_direction_ids is not None:
-            family = _scope_family(cur, allowed_direction_ids)
-            if not family:
-                cur.close(); conn.close()
-                return []
-            scope_sql = f" AND {_SUBJECT_DIRECTION} = ANY(%s)"
-            scope_params = (family,)
-        kind_sql, kind_params = "", ()
-        if subject_kind:
-            kind_sql, kind_params = " AND rc.subject_kind = %s", (subjects_mod.normalise_kind(subject_kind),)
+        cur = conn.cursor()
+        filters = _queue_filters(cur, allowed_direction_ids, subject_kind)
+        if filters is None:
+            cur.close(); conn.close()
+            return []
+        filter_sql, filter_params = filters
+        after_sql, after_params = "", ()
+        if keyset:
+            priority, queued_at, kind, call_id = keyset
+            after_sql = _QUEUE_AFTER
+            after_params = (priority, priority, queued_at, queued_at, kind, call_id)
+            offset = 0
         cur.execute(
-            f"""SELECT rc.call_id, d.name, {_SUBJECT_OPERATOR}, {_SUBJECT_DATETIME}, c.score,
-                      rc.payload->'criteria', rc.payload->'asr_mean_conf', rc.created_at,
-                      {_SUBJECT_DIRECTION}, run.evaluation_fingerprint::text,
-                      run.fingerprint_components, rc.subject_kind, rc.payload->'media',
-                      rc.payload->'ai_score', rc.payload->'score_breakdown'
-                 FROM ai_review_cache rc""" + _SUBJECT_JOIN + """
-                 LEFT JOIN ai_evaluation_meta m
-                        ON m.subject_kind = rc.subject_kind AND m.call_id = rc.call_id
-                           AND m.model = rc.model
-                 LEFT JOIN LATERAL (
-                     SELECT r.evaluation_fingerprint, r.fingerprint_components
-                       FROM ai_evaluation_runs r
-                      WHERE r.subject_kind = rc.subject_kind AND r.call_id = rc.call_id
-                        AND r.status = 'succeeded'
-                        AND r.run_kind IN ('standard','force','batch')
-                      ORDER BY r.created_at DESC, r.id::text DESC
-                      LIMIT 1
-                 ) run ON true
-                WHERE rc.model = %s AND m.review_outcome IS NULL"""
-            + _SUBJECT_EXISTS + scope_sql + kind_sql + """
-                ORDER BY rc.created_at DESC LIMIT %s""",
-            (config.CLAUDE_MODEL, *scope_params, *kind_params, _QUEUE_FETCH_CAP),
+            f"""SELECT m.call_id, d.name, {_SUBJECT_OPERATOR}, {_SUBJECT_DATETIME}, c.score,
+                      m.review_reasons, m.review_priority, m.queued_at,
+                      {_SUBJECT_DIRECTION}, m.run_fingerprint, m.run_transcript_hash,
+                      m.subject_kind, rc.payload->'score_breakdown',
+                      rc.payload->'ai_score'
+                 FROM ai_evaluation_meta m
+                 JOIN ai_review_cache rc
+                   ON rc.subject_kind = m.subject_kind AND rc.call_id = m.call_id
+                      AND rc.model = m.model""" + _SUBJECT_JOIN + """
+                WHERE m.model = %s AND m.review_outcome IS NULL
+                  AND m.review_priority IS NOT NULL AND m.queued_at IS NOT NULL"""
+            + _SUBJECT_EXISTS + filter_sql + after_sql + _QUEUE_ORDER + " LIMIT %s OFFSET %s",
+            (config.CLAUDE_MODEL, *filter_params, *after_params, limit, offset),
         )
         rows = cur.fetchall(); cur.close(); conn.close()
-        prio = review_queue.REASON_PRIORITY
         items = []
         for r in rows:
-            reasons = review_queue.review_reasons(r[5] or [], r[6], r[12] or {})
-            breakdown = r[14] if isinstance(r[14], dict) else {}
+            reasons = r[5] if isinstance(r[5], list) else []
+            breakdown = r[12] if isinstance(r[12], dict) else {}
+            kind = r[11] or config.SUBJECT_CALL
             items.append({"id": r[0], "direction": r[1], "operator": r[2] or "—",
                           "datetime": r[3], "human_score": r[4], "reasons": reasons or ["ok"],
-                          "subject": r[11] or config.SUBJECT_CALL,
+                          "subject": kind,
                           # Балл ИИ и та его часть, которую ИИ не проверял: в очереди
                           # решают, что смотреть первым, и 90 из зачтённых баллов —
                           # совсем не то же самое, что 90 проверенных.
                           "ai_score": r[13],
                           "unchecked_weight": breakdown.get("unchecked_weight") or 0,
-                          "_sev": min((prio.index(x) for x in reasons), default=len(prio)),
-                          "_ts": r[7], "_direction_id": r[8],
-                          "_run_fp": r[9], "_run_components": r[10]})
-        items.sort(key=lambda i: (i["_sev"], -(i["_ts"].timestamp() if i["_ts"] else 0)))
-        items = items[offset:offset + limit]
+                          "cursor": queue_cursor(r[6], r[7], kind, r[0]),
+                          "_direction_id": r[8], "_run_fp": r[9],
+                          "_run_components": {"transcript_hash": r[10]} if r[10] else None})
         _flag_stale_evaluations(items)
         for i in items:
-            for key in ("_sev", "_ts", "_direction_id", "_run_fp", "_run_components"):
+            for key in ("_direction_id", "_run_fp", "_run_components"):
                 i.pop(key, None)
         return items
     except Exception as exc:
@@ -222,26 +255,22 @@ def review_queue_count(allowed_direction_ids=None, subject_kind=None) -> int:
     conn = None
     try:
         conn = config.connect_ro()
-        cur = conn.cursor(); cur.execute("SET client_encoding TO 'UTF8'")
-        scope_sql, scope_params = "", ()
-        if allowed_direction_ids is not None:
-            family = _scope_family(cur, allowed_direction_ids)
-            if not family:
-                cur.close(); conn.close()
-                return 0
-            scope_sql = f" AND {_SUBJECT_DIRECTION} = ANY(%s)"
-            scope_params = (family,)
-        kind_sql, kind_params = "", ()
-        if subject_kind:
-            kind_sql, kind_params = " AND rc.subject_kind = %s", (subjects_mod.normalise_kind(subject_kind),)
+        cur = conn.cursor()
+        filters = _queue_filters(cur, allowed_direction_ids, subject_kind)
+        if filters is None:
+            cur.close(); conn.close()
+            return 0
+        filter_sql, filter_params = filters
         cur.execute(
-            """SELECT COUNT(*) FROM ai_review_cache rc""" + _SUBJECT_JOIN + """
-                 LEFT JOIN ai_evaluation_meta m
-                        ON m.subject_kind = rc.subject_kind AND m.call_id = rc.call_id
-                           AND m.model = rc.model
-                WHERE rc.model = %s AND m.review_outcome IS NULL"""
-            + _SUBJECT_EXISTS + scope_sql + kind_sql,
-            (config.CLAUDE_MODEL, *scope_params, *kind_params))
+            """SELECT COUNT(*)
+                 FROM ai_evaluation_meta m
+                 JOIN ai_review_cache rc
+                   ON rc.subject_kind = m.subject_kind AND rc.call_id = m.call_id
+                      AND rc.model = m.model""" + _SUBJECT_JOIN + """
+                WHERE m.model = %s AND m.review_outcome IS NULL
+                  AND m.review_priority IS NOT NULL AND m.queued_at IS NOT NULL"""
+            + _SUBJECT_EXISTS + filter_sql,
+            (config.CLAUDE_MODEL, *filter_params))
         n = cur.fetchone()[0]; cur.close(); conn.close()
         return int(n or 0)
     except Exception as exc:
@@ -260,7 +289,7 @@ def review_queue_count(allowed_direction_ids=None, subject_kind=None) -> int:
 def _recent_calls_fallback(limit: int, allowed_direction_ids=None) -> list[dict]:
     """Старое поведение очереди (до появления следа ревью): последние звонки ОП с записью."""
     conn = config.connect_ro()
-    cur = conn.cursor(); cur.execute("SET client_encoding TO 'UTF8'")
+    cur = conn.cursor()
     family = _scoped_op_family(cur, allowed_direction_ids)
     if not family:
         cur.close(); conn.close()
@@ -703,7 +732,7 @@ def _attach_human_review(payload: dict) -> dict:
     try:
         conn = config.connect_ro()
         try:
-            cur = conn.cursor(); cur.execute("SET client_encoding TO 'UTF8'")
+            cur = conn.cursor()
             cur.execute(sql, (int(call_id),))
             row = cur.fetchone(); cur.close()
         finally:
@@ -868,7 +897,9 @@ def _cache_put(call_id, model, payload, strict=False, subject_kind=config.SUBJEC
 def _meta_upsert(call_id, model, payload, subject_kind=config.SUBJECT_CALL):
     """Журнал оценки в ai_evaluation_meta: needs_review + причины из карточки.
     Новая оценка сбрасывает след ревью (переоценили → человек проверяет заново).
-    Best-effort: без RW/миграции оценка важнее журнала."""
+    Здесь же — всё, по чему строится очередь: приоритет, момент постановки и identity
+    последнего успешного прогона (для флага stale), чтобы очередь не сортировала и не
+    искала прогоны на чтении. Best-effort: без RW/миграции оценка важнее журнала."""
     try:
         from psycopg2.extras import Json
         reasons = _payload_reasons(payload)
@@ -877,19 +908,35 @@ def _meta_upsert(call_id, model, payload, subject_kind=config.SUBJECT_CALL):
             cur.execute(
                 """INSERT INTO ai_evaluation_meta
                      (subject_kind, call_id, direction_id, model, per_criterion,
-                      asr_mean_conf, needs_review, review_reasons)
-                   VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+                      asr_mean_conf, needs_review, review_reasons, review_priority, queued_at)
+                   VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s, now())
                    ON CONFLICT (subject_kind, call_id, model) DO UPDATE SET
                      per_criterion=EXCLUDED.per_criterion, asr_mean_conf=EXCLUDED.asr_mean_conf,
                      needs_review=EXCLUDED.needs_review, review_reasons=EXCLUDED.review_reasons,
+                     review_priority=EXCLUDED.review_priority, queued_at=now(),
+                     run_fingerprint=NULL, run_transcript_hash=NULL,
                      review_outcome=NULL, reviewed_by=NULL, reviewed_at=NULL, created_at=now()""",
                 (subject_kind, call_id, payload.get("direction_id") or 0, model,
                  Json(payload.get("criteria") or []), payload.get("asr_mean_conf"),
-                 bool(reasons), Json(reasons)))
+                 bool(reasons), Json(reasons), review_queue.review_priority(reasons)))
+            cur.execute(
+                """UPDATE ai_evaluation_meta m
+                      SET (run_fingerprint, run_transcript_hash) = (
+                          SELECT run.evaluation_fingerprint::text,
+                                 run.fingerprint_components->>'transcript_hash'
+                            FROM ai_evaluation_runs run
+                           WHERE run.subject_kind = m.subject_kind AND run.call_id = m.call_id
+                             AND run.status = 'succeeded'
+                             AND run.run_kind IN ('standard','force','batch')
+                           ORDER BY run.created_at DESC, run.id::text DESC
+                           LIMIT 1)
+                    WHERE m.subject_kind = %s AND m.call_id = %s AND m.model = %s""",
+                (subject_kind, call_id, model))
         conn.close()
     except Exception:
         logging.exception("ai-qa: не удалось записать ai_evaluation_meta (%s %s)",
                           subject_kind, call_id)
+    trust_rollups.refresh_subject_safe(subject_kind, call_id)
 
 
 def _record_review_outcome(call_id, outcome, reviewer_id=None, *, payload=None, model=None,
@@ -918,6 +965,7 @@ def _record_review_outcome(call_id, outcome, reviewer_id=None, *, payload=None,
     except Exception:
         logging.exception("ai-qa: не удалось записать итог ревью (%s %s)",
                           subject_kind, call_id)
+    trust_rollups.refresh_subject_safe(subject_kind, call_id)
 
 
 def _claim_review_outcome(cur, *, call_id: int, outcome: str, reviewer_id,
@@ -1599,7 +1647,6 @@ def adjudications_list(direction=None, q=None, *, status=None, index_status=None
     conn = None
     try:
         conn = config.connect_ro(); cur = conn.cursor()
-        cur.execute("SET client_encoding TO 'UTF8'")
         where, params = ["1=1"], []
         if allowed_direction_ids is not None:
             # Правила каталога ключуются каноническим id направления.
@@ -1818,7 +1865,6 @@ def _ai_qa_live_direction_ids() -> list[int]:
     conn = config.connect_ro()
     try:
         with conn.cursor() as cur:
-            cur.execute("SET client_encoding TO 'UTF8'")
             cur.execute("""SELECT id FROM directions
                             WHERE department_id=%s AND canonical_id IS NULL
                               AND COALESCE(is_active, TRUE)""",
@@ -2349,6 +2395,7 @@ def _save_adjudications_locked(call_id, direction_id, items, reviewer_id=None, *
     finally:
         conn.close()
 
+    trust_rollups.refresh_subject_safe(subject_kind, call_id)
     _record_rule_review_feedback(
         payload.get("_evaluation_run_id"),
         corrected_criterion_ids={item["criterion_id"] for item in validated},
@@ -2933,7 +2980,7 @@ def random_call(allowed_direction_ids=None) -> dict:
     Сначала из ЕЩЁ НЕ оценённых ИИ (каждый вызов = новый сигнал за те же деньги);
     если все уже оценены — любой."""
     conn = config.connect_ro()
-    cur = conn.cursor(); cur.execute("SET client_encoding TO 'UTF8'")
+    cur = conn.cursor()
     base = """SELECT c.id, d.name, u.name, TO_CHAR(c.created_at,'DD.MM HH24:MI'), c.score
                 FROM calls c
                 LEFT JOIN directions d ON c.direction_id = d.id
@@ -2968,7 +3015,7 @@ def random_chat_episode(allowed_direction_ids=None) -> dict:
     направления Верификаторов. Сначала берём ещё не оценённые ИИ эпизоды —
     каждый вызов даёт новый сигнал за те же деньги."""
     conn = config.connect_ro()
-    cur = conn.cursor(); cur.execute("SET client_encoding TO 'UTF8'")
+    cur = conn.cursor()
     try:
         wz_family = subjects_mod.wz_direction_family(cur)
         if not wz_family:
@@ -3016,7 +3063,7 @@ def chat_eligibility_overview(allowed_direction_ids=None) -> dict:
     Нужно, чтобы порог 90% не выглядел «оценок почему-то нет»: видно, что чаты
     есть, но в них отвечали несколько операторов."""
     conn = config.connect_ro()
-    cur = conn.cursor(); cur.execute("SET client_encoding TO 'UTF8'")
+    cur = conn.cursor()
     try:
         wz_family = subjects_mod.wz_direction_family(cur)
         if allowed_direction_ids is not None:
@@ -3066,7 +3113,7 @@ def evaluations_count(allowed_direction_ids=None, subject_kind=None) -> int:
     conn = None
     try:
         conn = config.connect_ro()
-        cur = conn.cursor(); cur.execute("SET client_encoding TO 'UTF8'")
+        cur = conn.cursor()
         scope_sql, scope_params = "", ()
         if allowed_direction_ids is not None:
             family = _scope_family(cur, allowed_direction_ids)
@@ -3109,7 +3156,7 @@ def evaluations_list(limit=100, offset=0, allowed_direction_ids=None,
         limit = max(1, min(int(limit), 500))
         offset = max(0, int(offset))
         conn = config.connect_ro()
-        cur = conn.cursor(); cur.execute("SET client_encoding TO 'UTF8'")
+        cur = conn.cursor()
         scope_sql, scope_params = "", ()
         if allowed_direction_ids is not None:
             family = _scope_family(cur, allowed_direction_ids)
@@ -3157,6 +3204,23 @@ def _rate(hits, total):
     return {"pct": round(100 * hits / total), "hits": hits, "total": total} if total else None
 
 
+def _verdict_cells(criteria, scores):
+    """Пары «человек × ИИ» одной карточки: (критерий, вердикт человека, вердикт ИИ).
+    Сверяются только критерии по разговору с настоящими вердиктами обеих сторон;
+    Pending/сбой у ИИ и отсутствие эталона у человека пропускаются."""
+    for crit in criteria or []:
+        if crit.get("source") != "transcript":
+            continue
+        idx, ai = crit.get("idx"), crit.get("ai")
+        if ai not in _VERDICTS:
+            continue  # Pending/сбой — не вердикт
+        raw = scores[idx] if isinstance(scores, list) and idx is not None and idx < len(scores) else None
+        hv = _norm_verdict(raw)
+        if hv not in _VERDICTS:
+            continue
+        yield crit.get("name") or f"#{idx}", hv, ai
+
+
 def _verdict_metrics(rows) -> dict:
     """Метрики доверия по «сырому» эталону — человеческим оценкам calls.scores.
 
@@ -3167,39 +3231,40 @@ def _verdict_metrics(rows) -> dict:
       correct_reliability — когда ИИ ставит Correct, как часто человек согласен.
     «Deficiency» (частичный зачёт) — полноправный вердикт обеих сторон и входит
     в матрицу; счётчик deficiency оставлен в ответе (=0) для совместимости."""
+    return _verdict_metrics_from_cells(
+        (direction or "—", name, hv, ai, 1)
+        for criteria, scores, direction in rows
+        for name, hv, ai in _verdict_cells(criteria, scores))
+
+
+def _verdict_metrics_from_cells(cells) -> dict:
+    """То же, что _verdict_metrics, но из готовых ячеек (направление, критерий,
+    человек, ИИ, количество) — так их отдают дневные сводки review.rollups."""
     matrix = {h: {a: 0 for a in _VERDICTS} for h in _VERDICTS}
     per = {}
     deficiency = 0
-    for criteria, scores, direction in rows:
-        for crit in criteria or []:
-            if crit.get("source") != "transcript":
-                continue
-            idx, ai = crit.get("idx"), crit.get("ai")
-            if ai not in _VERDICTS:
-                continue  # Pending/сбой — не вердикт
-            raw = scores[idx] if isinstance(scores, list) and idx is not None and idx < len(scores) else None
-            hv = _norm_verdict(raw)
-            if hv not in _VERDICTS:
-                continue
-            matrix[hv][ai] += 1
-            d = per.setdefault((direction or "—", crit.get("name") or f"#{idx}"),
-                               {"n": 0, "match": 0, "alarms": 0, "alarm_hits": 0, "misses": 0})
-            d["n"] += 1
-            if hv == ai:
-                d["match"] += 1
-            if ai == "Incorrect":
-                d["alarms"] += 1
-                if hv == "Incorrect":
-                    d["alarm_hits"] += 1
-            elif hv == "Incorrect":
-                d["misses"] += 1  # человек видит нарушение, ИИ — нет
+    for direction, name, hv, ai, n in cells:
+        if hv not in _VERDICTS or ai not in _VERDICTS or not n:
+            continue
+        matrix[hv][ai] += n
+        d = per.setdefault((direction or "—", name),
+                           {"n": 0, "match": 0, "alarms": 0, "alarm_hits": 0, "misses": 0})
+        d["n"] += n
+        if hv == ai:
+            d["match"] += n
+        if ai == "Incorrect":
+            d["alarms"] += n
+            if hv == "Incorrect":
+                d["alarm_hits"] += n
+        elif hv == "Incorrect":
+            d["misses"] += n  # человек видит нарушение, ИИ — нет
 
     tot = sum(matrix[h][a] for h in _VERDICTS for a in _VERDICTS)
     by_criterion = [
         {"direction": dr, "name": nm, "n": d["n"], "v": round(100 * d["match"] / d["n"]),
          "alarms": d["alarms"], "alarm_hits": d["alarm_hits"],
          "false_alarms": d["alarms"] - d["alarm_hits"], "misses": d["misses"]}
-        for (dr, nm), d in per.items()]
+        for (dr, nm), d in per.items() if d["n"]]
     return {
         "total": tot,
         "agreement": round(100 * sum(matrix[v][v] for v in _VERDICTS) / tot) if tot else None,
@@ -3215,29 +3280,17 @@ def _verdict_metrics(rows) -> dict:
     }
 
 
-def _reviewed_metrics(cur):
-    """«Чистый» эталон: только звонки, где человек нажал «Подтвердить»/«Сохранить разбор».
-    confirmed — все вердикты ИИ одобрены; adjudicated — исправленные критерии берём из
-    qa_adjudications, неисправленные считаются одобренными. None — миграции меты ещё нет."""
-    try:
-        cur.execute("""SELECT call_id, review_outcome, per_criterion, subject_kind
-                         FROM ai_evaluation_meta
-                        WHERE review_outcome IS NOT NULL AND model = %s""",
-                    (config.CLAUDE_MODEL,))
-        # Совместимость с БД до миграции subject_kind: строка без типа = звонок.
-        rows = [tuple(r) + (config.SUBJECT_CALL,) if len(r) == 3 else tuple(r)
-                for r in cur.fetchall()]
-    except Exception:
-        return None  # колонок ещё нет — появятся после деплоя (миграция на старте)
-    out = {"confirmed": 0, "adjudicated": 0, "endorsed": 0, "corrected": 0, "alarm_precision": None}
-    if not rows:
-        return out
+_REVIEW_COUNTERS = ("confirmed", "adjudicated", "endorsed", "corrected", "alarms", "alarm_hits")
+
+
+def _review_corrections(cur, call_ids) -> dict:
+    """Исправления человека по критериям: {(subject_kind, call_id, idx): verdict}.
+    Исправления могут быть и от ревью до появления следа — ключ call+criterion этого не
+    различает, для точности тревог это безопасно (исправление = человек не согласен).
+    Деактивированные RAG-правила остаются следом ревью. Если по тому же критерию
+    разбор создавали повторно, человеческим эталоном считаем самый свежий."""
     corr = {}
     try:
-        # Исправления могут быть и от ревью до появления следа — ключ call+criterion этого не различает,
-        # для точности тревог это безопасно (исправление = человек не согласен).
-        # Деактивированные RAG-правила остаются следом ревью. Если по тому же критерию
-        # разбор создавали повторно, человеческим эталоном считаем самый свежий.
         cur.execute("""SELECT DISTINCT ON (subject_kind, call_id, criterion_idx)
                               subject_kind, call_id, criterion_idx, correct_verdict
                          FROM (
@@ -3252,8 +3305,7 @@ def _reviewed_metrics(cur):
                                WHERE call_id=ANY(%s)
                          ) corrections
                         ORDER BY subject_kind, call_id, criterion_idx, created_at DESC, id DESC""",
-                    ([r[0] for r in rows], [r[0] for r in rows]))
-        corr = {}
+                    (list(call_ids), list(call_ids)))
         for row in cur.fetchall():
             if len(row) == 3:  # БД до миграции subject_kind
                 corr[(config.SUBJECT_CALL, row[0], row[1])] = row[2]
@@ -3261,26 +3313,61 @@ def _reviewed_metrics(cur):
                 corr[(row[0] or config.SUBJECT_CALL, row[1], row[2])] = row[3]
     except Exception:
         pass
-    alarms = alarm_hits = 0
-    for call_id, outcome, crits, subject_kind in rows:
-        subject_kind = subject_kind or config.SUBJECT_CALL
-        out["confirmed" if outcome == "confirmed" else "adjudicated"] += 1
-        for c in crits or []:
-            if c.get("source") != "transcript" or c.get("ai") not in _VERDICTS:
-                continue
-            # confirmed означает, что в ТЕКУЩЕМ ревью человек одобрил все verdict'ы ИИ;
-            # старые разборы того же субъекта не должны превращать это ревью в исправленное.
-            hv = (c.get("ai") if outcome == "confirmed"
-                  else corr.get((subject_kind, call_id, c.get("idx")), c.get("ai")))
-            out["endorsed" if hv == c.get("ai") else "corrected"] += 1
-            if c.get("ai") == "Incorrect":
-                alarms += 1
-                if hv == "Incorrect":
-                    alarm_hits += 1
-    out["alarm_precision"] = _rate(alarm_hits, alarms)
+    return corr
+
+
+def _review_contribution(call_id, outcome, crits, subject_kind, corr) -> dict:
+    """Вклад одного проверенного субъекта в «чистый» эталон (счётчики _REVIEW_COUNTERS)."""
+    subject_kind = subject_kind or config.SUBJECT_CALL
+    out = dict.fromkeys(_REVIEW_COUNTERS, 0)
+    out["confirmed" if outcome == "confirmed" else "adjudicated"] += 1
+    for c in crits or []:
+        if c.get("source") != "transcript" or c.get("ai") not in _VERDICTS:
+            continue
+        # confirmed означает, что в ТЕКУЩЕМ ревью человек одобрил все verdict'ы ИИ;
+        # старые разборы того же субъекта не должны превращать это ревью в исправленное.
+        hv = (c.get("ai") if outcome == "confirmed"
+              else corr.get((subject_kind, call_id, c.get("idx")), c.get("ai")))
+        out["endorsed" if hv == c.get("ai") else "corrected"] += 1
+        if c.get("ai") == "Incorrect":
+            out["alarms"] += 1
+            if hv == "Incorrect":
+                out["alarm_hits"] += 1
     return out
 
 
+def _reviewed_from_counters(counters) -> dict:
+    out = {key: int(counters.get(key) or 0)
+           for key in ("confirmed", "adjudicated", "endorsed", "corrected")}
+    out["alarm_precision"] = _rate(int(counters.get("alarm_hits") or 0),
+                                   int(counters.get("alarms") or 0))
+    return out
+
+
+def _reviewed_metrics(cur):
+    """«Чистый» эталон: только звонки, где человек нажал «Подтвердить»/«Сохранить разбор».
+    confirmed — все вердикты ИИ одобрены; adjudicated — исправленные критерии берём из
+    qa_adjudications, неисправленные считаются одобренными. None — миграции меты ещё нет."""
+    try:
+        cur.execute("""SELECT call_id, review_outcome, per_criterion, subject_kind
+                         FROM ai_evaluation_meta
+                        WHERE review_outcome IS NOT NULL AND model = %s""",
+                    (config.CLAUDE_MODEL,))
+        # Совместимость с БД до миграции subject_kind: строка без типа = звонок.
+        rows = [tuple(r) + (config.SUBJECT_CALL,) if len(r) == 3 else tuple(r)
+                for r in cur.fetchall()]
+    except Exception:
+        return None  # колонок ещё нет — появятся после деплоя (миграция на старте)
+    if not rows:
+        return _reviewed_from_counters({})
+    corr = _review_corrections(cur, [r[0] for r in rows])
+    total = dict.fromkeys(_REVIEW_COUNTERS, 0)
+    for call_id, outcome, crits, subject_kind in rows:
+        for key, value in _review_contribution(call_id, outcome, crits, subject_kind, corr).items():
+            total[key] += value
+    return _reviewed_from_counters(total)
+
+
 def _rag_observability(cur) -> dict:
     """Operational SLOs plus the latest leakage-safe paired experiment report."""
     out = {"status": "ready", "runs": 0, "degraded_runs": 0, "no_match_runs": 0,
@@ -3345,19 +3432,85 @@ def _rag_observability(cur) -> dict:
     return out
 
 
+def _raw_reference_rows(cur, *, scope_family=None, subjects=None) -> list[tuple]:
+    """«Сырой» эталон: последняя карточка каждого субъекта (без дублей по тегам моделей)
+    рядом с человеческой оценкой. Строки: (subject_kind, call_id, model, день карточки,
+    direction_id субъекта, criteria, scores, название направления из карточки).
+    subjects — [(subject_kind, call_id)], только эти субъекты (для сводок review.rollups)."""
+    subject_sql, params = "", []
+    if subjects is not None:
+        subject_sql = """
+                        WHERE (rc.subject_kind, rc.call_id) IN (
+                              SELECT * FROM unnest(%s::text[], %s::bigint[]))"""
+        params += [[k for k, _ in subjects], [int(i) for _, i in subjects]]
+    scope_sql = ""
+    if scope_family is not None:
+        scope_sql = " AND COALESCE(c.direction_id, ue.direction_id) = ANY(%s)"
+        params.append(scope_family or [-1])
+    cur.execute(
+        """SELECT t.subject_kind, t.call_id, t.model, t.day,
+                  COALESCE(c.direction_id, ue.direction_id),
+                  t.criteria, COALESCE(c.scores, hc.scores), t.direction
+             FROM (SELECT DISTINCT ON (rc.subject_kind, rc.call_id)
+                          rc.subject_kind, rc.call_id, rc.model,
+                          (rc.created_at AT TIME ZONE 'Asia/Almaty')::date AS day,
+                          rc.payload->'criteria' AS criteria,
+                          rc.payload->>'direction' AS direction
+                     FROM ai_review_cache rc""" + subject_sql + """
+                    ORDER BY rc.subject_kind, rc.call_id, rc.created_at DESC) t
+             LEFT JOIN calls c
+                    ON t.subject_kind = 'call' AND c.id = t.call_id
+             LEFT JOIN wazzup_episodes e
+                    ON t.subject_kind = 'wz_episode' AND e.id = t.call_id
+             LEFT JOIN users ue ON ue.id = e.operator_user_id
+             LEFT JOIN LATERAL (
+                 SELECT hcalls.scores
+                   FROM c2d_chat_snapshots s
+                   JOIN calls hcalls ON hcalls.c2d_snapshot_id = s.id
+                  WHERE e.id IS NOT NULL AND s.source = 'wazzup'
+                    AND s.wz_channel_id = e.channel_id AND s.wz_chat_id = e.chat_id
+                    AND s.episode_start = e.started_at
+                    AND COALESCE(hcalls.is_draft, FALSE) = FALSE
+                  ORDER BY hcalls.created_at DESC LIMIT 1
+             ) hc ON true
+            WHERE COALESCE(c.scores, hc.scores) IS NOT NULL""" + scope_sql,
+        tuple(params))
+    return cur.fetchall()
+
+
+def _reviewed_rows(cur, *, subjects=None) -> list[tuple]:
+    """Проверенные человеком субъекты всех моделей: (call_id, outcome, per_criterion,
+    subject_kind, model, день ревью, direction_id) — источник «чистого» эталона в сводках."""
+    subject_sql, params = "", ()
+    if subjects is not None:
+        subject_sql = """ AND (subject_kind, call_id) IN (
+                              SELECT * FROM unnest(%s::text[], %s::bigint[]))"""
+        params = ([k for k, _ in subjects], [int(i) for _, i in subjects])
+    cur.execute(
+        """SELECT call_id, review_outcome, per_criterion, subject_kind, model,
+                  (COALESCE(reviewed_at, created_at) AT TIME ZONE 'Asia/Almaty')::date,
+                  direction_id
+             FROM ai_evaluation_meta
+            WHERE review_outcome IS NOT NULL""" + subject_sql,
+        params)
+    return cur.fetchall()
+
+
 def stats(allowed_direction_ids=None) -> dict:
     """Метрики доверия для дашборда. Два эталона: «сырой» (человеческие оценки из
     calls.scores — много данных, но Correct в форме — дефолт) и «чистый» (итоги ревью —
     мало, но человек реально смотрел). Пустые места — честно null/[], без выдуманных цифр.
     При заданном скоупе (СВ ОП) очередь/оценённые/сырой эталон считаются только по его
-    направлениям; операционные метрики reviewed/rag остаются общесистемными."""
+    направлениям; операционные метрики reviewed/rag остаются общесистемными.
+    Оба эталона складываются из дневных сводок review.rollups; пока сводки не
+    собраны (backfill), — полным пересчётом."""
     out = {"queue": 0, "evaluated": 0, "agreement": None, "by_criterion": [], "focus": [],
            "alarm_precision": None, "recall": None, "correct_reliability": None,
            "matrix": None, "deficiency": 0, "reviewed": None, "rag": None}
     conn = None
     try:
         conn = config.connect_ro()
-        cur = conn.cursor(); cur.execute("SET client_encoding TO 'UTF8'")
+        cur = conn.cursor()
         scope_family = None
         if allowed_direction_ids is not None:
             scope_family = _scope_family(cur, allowed_direction_ids)
@@ -3392,35 +3545,22 @@ def stats(allowed_direction_ids=None) -> dict:
                 (family or [-1],))
             out["queue"] = cur.fetchone()[0]
 
-        # Сырой эталон: последняя оценка каждого звонка (без дублей по тегам моделей).
-        cur.execute(
-            """SELECT t.criteria, COALESCE(c.scores, hc.scores), t.direction
-                 FROM (SELECT DISTINCT ON (rc.subject_kind, rc.call_id)
-                              rc.subject_kind, rc.call_id,
-                              rc.payload->'criteria' AS criteria,
-                              rc.payload->>'direction' AS direction
-                         FROM ai_review_cache rc
-                        ORDER BY rc.subject_kind, rc.call_id, rc.created_at DESC) t
-                 LEFT JOIN calls c
-                        ON t.subject_kind = 'call' AND c.id = t.call_id
-                 LEFT JOIN wazzup_episodes e
-                        ON t.subject_kind = 'wz_episode' AND e.id = t.call_id
-                 LEFT JOIN users ue ON ue.id = e.operator_user_id
-                 LEFT JOIN LATERAL (
-                     SELECT hcalls.scores
-                       FROM c2d_chat_snapshots s
-                       JOIN calls hcalls ON hcalls.c2d_snapshot_id = s.id
-                      WHERE e.id IS NOT NULL AND s.source = 'wazzup'
-                        AND s.wz_channel_id = e.channel_id AND s.wz_chat_id = e.chat_id
-                        AND s.episode_start = e.started_at
-                        AND COALESCE(hcalls.is_draft, FALSE) = FALSE
-                      ORDER BY hcalls.created_at DESC LIMIT 1
-                 ) hc ON true
-                WHERE COALESCE(c.scores, hc.scores) IS NOT NULL"""
-            + (" AND COALESCE(c.direction_id, ue.direction_id) = ANY(%s)"
-               if scope_family is not None else ""),
-            ((scope_family or [-1],) if scope_family is not None else ()))
-        m = _verdict_metrics(cur.fetchall())
+        # Метрики доверия — из дневных сводок (review.rollups), пока они собраны;
+        # до первой сборки и при её сбое — полный пересчёт по кэшу, как раньше.
+        rolled = None
+        try:
+            rolled = trust_rollups.dashboard(cur, scope_family=scope_family,
+                                             model=config.CLAUDE_MODEL)
+        except Exception as exc:
+            if not runtime_store.is_schema_compat_error(exc):
+                logging.exception("ai-qa: сводки метрик доверия недоступны")
+            conn.rollback()
+        if rolled is not None:
+            m, reviewed = rolled
+        else:
+            m = _verdict_metrics(
+                row[5:8] for row in _raw_reference_rows(cur, scope_family=scope_family))
+            reviewed = None
         for k in ("agreement", "alarm_precision", "recall", "correct_reliability", "matrix", "deficiency"):
             out[k] = m[k]
         out["by_criterion"] = sorted([r for r in m["by_criterion"] if r["n"] >= 3], key=lambda x: x["v"])
@@ -3435,7 +3575,7 @@ def stats(allowed_direction_ids=None) -> dict:
                 r["rules"] = rules.get((r["direction"], r["name"]), 0)
         except Exception:
             pass
-        out["reviewed"] = _reviewed_metrics(cur)
+        out["reviewed"] = reviewed if rolled is not None else _reviewed_metrics(cur)
         try:
             out["rag"] = _rag_observability(cur)
         except Exception:
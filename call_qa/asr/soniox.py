@@ -26,13 +26,7 @@ def transcribe_file_full(path: str, *, langs=None, diarize=True, timeout_s=300)
     with open(path, "rb") as fh:
         up = requests.post(f"{base}/v1/files", headers=h, files={"file": fh}, timeout=120).json()
     fid = up["id"]
-    body = {
-        "model": config.SONIOX_MODEL,
-        "file_id": fid,
-        "language_hints": langs or config.SONIOX_LANGS,
-        "enable_language_identification": True,
-        "enable_speaker_diarization": diarize,
-    }
+    body = _request_body(fid, langs, diarize)
     tid = requests.post(f"{base}/v1/transcriptions", headers=h, json=body, timeout=60).json()["id"]
     t0 = time.time()
     while True:
@@ -50,7 +44,13 @@ def transcribe_file_full(path: str, *, langs=None, diarize=True, timeout_s=300)
             requests.delete(u, headers=h, timeout=30)
         except Exception:
             pass
-    meta = {
+    return {"tokens": [_with_timing(t) for t in tr.get("tokens", [])],
+            "meta": _meta(tid, up, st, tr, langs)}
+
+
+def _meta(tid, up: dict, st: dict, tr: dict, langs=None) -> dict:
+    """Метаданные распознавания — общие для синхронного и асинхронного клиента."""
+    return {
         "transcription_id": tid,
         "audio_duration_ms": st.get("audio_duration_ms"),      # биллинговая длительность вендора
         "model": st.get("model") or config.SONIOX_MODEL,
@@ -63,7 +63,16 @@ def transcribe_file_full(path: str, *, langs=None, diarize=True, timeout_s=300)
         "created_at": st.get("created_at"),
         "vendor_text": tr.get("text"),                          # собственная сборка вендора
     }
-    return {"tokens": [_with_timing(t) for t in tr.get("tokens", [])], "meta": meta}
+
+
+def _request_body(fid, langs=None, diarize=True) -> dict:
+    return {
+        "model": config.SONIOX_MODEL,
+        "file_id": fid,
+        "language_hints": langs or config.SONIOX_LANGS,
+        "enable_language_identification": True,
+        "enable_speaker_diarization": diarize,
+    }
 
 
 def _with_timing(tok: dict) -> dict:
@@ -0,0 +1,192 @@
+"""Асинхронный клиент Soniox для пакетного прогона.
+
+Синхронный soniox.transcribe_file_full держит поток на всё распознавание: запись
+сначала ложится во временный файл, затем поток спит в опросе статуса до 300 с.
+Месячный прогон в таком виде масштабируется только числом потоков.
+
+Здесь одно событийное кольцо держит сотни распознаваний одновременно:
+  • запись читается из GCS потоком и сразу уходит в multipart-загрузку — диск
+    не участвует, в памяти только текущий кусок;
+  • статус опрашивается с адаптивной паузой (SONIOX_POLL_INITIAL_S, рост в 1.5 раза
+    до SONIOX_POLL_MAX_S) — короткие звонки забираются быстро, длинные не
+    засыпают вендора запросами;
+  • SONIOX_MAX_IN_FLIGHT — общий потолок распознаваний у вендора на весь
+    движок: слот занят от начала загрузки до удаления записи у Soniox.
+
+Результат тот же, что у синхронного клиента: {"tokens": [...], "meta": {...}},
+его принимает soniox.assemble. Запись и файл у вендора удаляются и при ошибке —
+гигиена ПДн не зависит от исхода."""
+from __future__ import annotations
+import asyncio
+import logging
+import random
+import secrets
+from urllib.parse import quote
+
+import httpx
+
+from .. import config
+from . import soniox
+
+_GCS_SCOPE = "https://www.googleapis.com/auth/devstorage.read_only"
+_GCS_MEDIA = "https://storage.googleapis.com/storage/v1/b/{bucket}/o/{name}"
+_CHUNK_BYTES = 256 * 1024
+_sleep = asyncio.sleep  # подменяется в тестах
+
+
+class SonioxEngine:
+    """Движок распознавания: один httpx.AsyncClient и общий семафор вендора.
+
+    Использование:
+        async with SonioxEngine() as engine:
+            got = await engine.transcribe_gcs("bucket/path/call.mp3")
+    """
+
+    def __init__(self, *, max_in_flight: int | None = None, client: httpx.AsyncClient | None = None,
+                 poll_initial_s: float | None = None, poll_max_s: float | None = None,
+                 timeout_s: float | None = None, token_provider=None):
+        self.max_in_flight = max(1, int(max_in_flight or config.SONIOX_MAX_IN_FLIGHT))
+        self.poll_initial_s = float(poll_initial_s or config.SONIOX_POLL_INITIAL_S)
+        self.poll_max_s = max(self.poll_initial_s, float(poll_max_s or config.SONIOX_POLL_MAX_S))
+        self.timeout_s = float(timeout_s or config.SONIOX_ASYNC_TIMEOUT_S)
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._own_client = client is None
+        self._client = client or httpx.AsyncClient(
+            timeout=httpx.Timeout(60, connect=15),
+            limits=httpx.Limits(max_connections=self.max_in_flight * 2,
+                                max_keepalive_connections=self.max_in_flight))
+        self._token_provider = token_provider
+        self._token_lock = asyncio.Lock()
+        self._creds = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+        return False
+
+    async def aclose(self):
+        if self._own_client:
+            await self._client.aclose()
+
+    # --- GCS ---
+
+    async def _gcs_token(self) -> str:
+        if self._token_provider is not None:
+            return await self._token_provider()
+        async with self._token_lock:
+            if self._creds is None:
+                from google.oauth2 import service_account
+                self._creds = service_account.Credentials.from_service_account_info(
+                    config.google_sa_info(), scopes=[_GCS_SCOPE])
+            if not self._creds.valid:
+                from google.auth.transport.requests import Request
+                await asyncio.to_thread(self._creds.refresh, Request())
+            return self._creds.token
+
+    async def gcs_chunks(self, audio_path: str):
+        """audio_path = 'bucket/blob' → куски объекта по мере чтения из GCS."""
+        bucket, name = audio_path.split("/", 1)
+        url = _GCS_MEDIA.format(bucket=quote(bucket, safe=""), name=quote(name, safe=""))
+        headers = {"Authorization": f"Bearer {await self._gcs_token()}"}
+        async with self._client.stream("GET", url, params={"alt": "media"},
+                                       headers=headers) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.aiter_bytes(_CHUNK_BYTES):
+                yield chunk
+
+    # --- Soniox ---
+
+    async def transcribe_gcs(self, audio_path: str, *, langs=None, diarize=True) -> dict:
+        """GCS → Soniox без временного файла. Результат как у transcribe_file_full."""
+        filename = audio_path.rsplit("/", 1)[-1] or "audio.mp3"
+        return await self.transcribe_stream(self.gcs_chunks(audio_path), filename=filename,
+                                            langs=langs, diarize=diarize)
+
+    async def transcribe_stream(self, chunks, *, filename="audio.mp3", langs=None,
+                                diarize=True) -> dict:
+        """Асинхронный поток байтов записи → {"tokens": [...], "meta": {...}}."""
+        async with self._slots:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                return await asyncio.wait_for(
+                    self._transcribe(chunks, filename, langs, diarize), self.timeout_s)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"soniox: нет результата за {self.timeout_s:.0f}с") from None
+            finally:
+                self.in_flight -= 1
+
+    async def _transcribe(self, chunks, filename, langs, diarize) -> dict:
+        base, h = config.SONIOX_BASE, soniox.H()
+        boundary = secrets.token_hex(16)
+        up = tid = None
+        try:
+            resp = await self._client.post(
+                f"{base}/v1/files",
+                headers={**h, "Content-Type": f"multipart/form-data; boundary={boundary}"},
+                content=_multipart(chunks, boundary, filename), timeout=httpx.Timeout(120))
+            up = _json(resp)
+            resp = await self._client.post(f"{base}/v1/transcriptions", headers=h,
+                                           json=soniox._request_body(up["id"], langs, diarize))
+            tid = _json(resp)["id"]
+            st = await self._wait(base, h, tid)
+            tr = _json(await self._client.get(f"{base}/v1/transcriptions/{tid}/transcript",
+                                              headers=h))
+        finally:
+            await self._cleanup(base, h, tid, (up or {}).get("id"))
+        return {"tokens": [soniox._with_timing(t) for t in tr.get("tokens", [])],
+                "meta": soniox._meta(tid, up, st, tr, langs)}
+
+    async def _wait(self, base, h, tid) -> dict:
+        """Опрос статуса с нарастающей паузой. Сетевые сбои и 5xx/429 на опросе не
+        роняют распознавание — это лишь пропущенный такт."""
+        delay = self.poll_initial_s
+        while True:
+            try:
+                resp = await self._client.get(f"{base}/v1/transcriptions/{tid}", headers=h)
+            except httpx.TransportError as exc:
+                logging.warning("soniox: опрос %s не удался (%s) — повтор", tid, exc)
+                st = {}
+            else:
+                if resp.status_code == 429 or resp.status_code >= 500:
+                    logging.warning("soniox: опрос %s — HTTP %s, повтор", tid, resp.status_code)
+                    st = {}
+                else:
+                    st = _json(resp)
+            if st.get("status") == "completed":
+                return st
+            if st.get("status") == "error":
+                raise RuntimeError(f"soniox: {st.get('error_message')}")
+            await _sleep(delay * random.uniform(0.9, 1.1))
+            delay = min(delay * 1.5, self.poll_max_s)
+
+    async def _cleanup(self, base, h, tid, fid):
+        urls = ([f"{base}/v1/transcriptions/{tid}"] if tid else []) + \
+               ([f"{base}/v1/files/{fid}"] if fid else [])
+        for url in urls:
+            try:
+                await self._client.delete(url, headers=h, timeout=30)
+            except Exception:
+                logging.warning("soniox: не удалось удалить %s", url)
+
+
+async def _multipart(chunks, boundary: str, filename: str):
+    """multipart/form-data с единственным полем file — тело собирается по мере
+    поступления кусков, без буфера на весь файл."""
+    safe_name = filename.replace('"', "").replace("\r", "").replace("\n", "")
+    yield (f"--{boundary}\r\n"
+           f'Content-Disposition: form-data; name="file"; filename="{safe_name}"\r\n'
+           "Content-Type: application/octet-stream\r\n\r\n").encode()
+    async for chunk in chunks:
+        if chunk:
+            yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+
+def _json(resp: httpx.Response) -> dict:
+    resp.raise_for_status()
+    return resp.json()
@@ -4,7 +4,8 @@
 Зачем: теневой режим — массовая сверка ИИ↔человек за прошлый период + прогрев кэша карточек.
 
 Два субъекта оценки (--subject):
-  call       — звонки: выборка месяца → GCS → Soniox ASR (параллельно) → батч оценок;
+  call       — звонки: выборка месяца → GCS → Soniox ASR (асинхронно, поток
+               из GCS прямо в загрузку) → батч оценок;
   wz_episode — эпизоды переписки Wazzup у Верификаторов: выборка пригодных эпизодов
                (доля ответов одного оператора ≥ порога) → ОТДЕЛЬНЫЙ батч описаний
                вложений (картинки через vision-модель, голосовые через Soniox) →
@@ -14,8 +15,13 @@
 поэтому ночной прогон описывает вложения вдвое дешевле интерактивного открытия
 карточки.
 
-Устойчивость: транскрипты и batch_id сохраняются в --workdir; повторный запуск продолжает
-с места остановки (уже закэшированные под текущим fingerprint субъекты пропускаются).
+Стадии идут конвейером, а не по очереди: готовые транскрипты сразу копятся в порции
+(--batch-size), каждая порция уходит отдельным батчем, а её результаты разбираются,
+как только батч завершён, — пока распознаются следующие звонки.
+
+Устойчивость: транскрипты, манифесты порций, batch_id и поштучный журнал разбора
+сохраняются в --workdir; повторный запуск продолжает с места остановки (уже
+закэшированные под текущим fingerprint субъекты пропускаются).
 
 Запуск:  python -m call_qa.batch_eval --month 2026-06 --fallback-month 2026-07 --min-calls 50
          python -m call_qa.batch_eval --subject wz_episode --month 2026-07
@@ -26,7 +32,10 @@ import os
 import sys
 import json
 import time
+import queue
+import asyncio
 import argparse
+import threading
 import tempfile
 from datetime import datetime, timezone
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -38,13 +47,14 @@ from . import llm
 from . import media as media_mod
 from . import subjects as subjects_mod
 from .asr import soniox
+from .asr import soniox_async
 from .evaluation import criteria as criteria_mod
 from .evaluation import criterion_config as cc
 from .evaluation import evaluator
 from .evaluation import runtime_store
 from .evaluation.fingerprint import content_hash, transcript_fingerprint
 from .rag import knowledge
-from .api import (_download, _lines_from_tokens, _ai_score, _cache_put, _meta_upsert,
+from .api import (_lines_from_tokens, _ai_score, _cache_put, _meta_upsert,
                   _audio_object_fingerprint, _evaluation_identity, _score_breakdown)
 
 _SUBJECT_PREFIX = {config.SUBJECT_CALL: "call", config.SUBJECT_WZ_EPISODE: "wz"}
@@ -87,6 +97,33 @@ def _manifest_path(workdir: str) -> str:
     return os.path.join(workdir, "batch_manifest.json")
 
 
+def _done_path(workdir: str) -> str:
+    return os.path.join(workdir, "batch_done.jsonl")
+
+
+def _done_items(workdir: str) -> list[dict]:
+    """Поштучный журнал опубликованных результатов батча. Строка дописывается
+    после записи прогона и кэша, поэтому оборванная последняя строка не учитывается."""
+    path = _done_path(workdir)
+    if not os.path.exists(path):
+        return []
+    items = []
+    with open(path, encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                continue
+    return items
+
+
+def _mark_done(workdir: str, custom_id: str, subject: dict) -> None:
+    with open(_done_path(workdir), "a", encoding="utf-8") as fh:
+        fh.write(json.dumps({"custom_id": custom_id, "subject": _subject_key(subject)}) + "\n")
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
 def _load_manifest(workdir: str) -> dict | None:
     path = _manifest_path(workdir)
     if not os.path.exists(path):
@@ -125,6 +162,18 @@ def _retry(fn, *, tries=6, delay=20, what=""):
             time.sleep(delay)
 
 
+async def _aretry(fn, *, tries=6, delay=20, what=""):
+    """_retry для корутин: fn() возвращает новую корутину на каждую попытку."""
+    for attempt in range(1, tries + 1):
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt == tries:
+                raise
+            log(f"сетевой сбой ({what or 'запрос'}): {e} — повтор {attempt}/{tries - 1} через {delay}с")
+            await asyncio.sleep(delay)
+
+
 def _month_bounds(month: str) -> tuple[str, str]:
     y, m = int(month[:4]), int(month[5:7])
     nxt = f"{y + (m == 12)}-{(m % 12) + 1:02d}-01"
@@ -136,7 +185,7 @@ def select_calls(month: str, fallback_month: str | None, min_calls: int, limit:
     Если их меньше min_calls — добавляется fallback-месяц."""
     def q(mon):
         lo, hi = _month_bounds(mon)
-        conn = config.connect_ro(); cur = conn.cursor(); cur.execute("SET client_encoding TO 'UTF8'")
+        conn = config.connect_ro(); cur = conn.cursor()
         cur.execute(
             """SELECT c.id, c.direction_id, d.name, u.name,
                       TO_CHAR(c.created_at,'DD.MM.YYYY, HH24:MI'), c.score, c.audio_path
@@ -174,7 +223,7 @@ def select_episodes(month: str, fallback_month: str | None, min_calls: int,
     переписку одному человеку нельзя (порог config.WZ_MIN_OPERATOR_SHARE)."""
     def q(mon):
         lo, hi = _month_bounds(mon)
-        conn = config.connect_ro(); cur = conn.cursor(); cur.execute("SET client_encoding TO 'UTF8'")
+        conn = config.connect_ro(); cur = conn.cursor()
         try:
             wz_family = subjects_mod.wz_direction_family(cur)
             if not wz_family:
@@ -215,9 +264,16 @@ def select_episodes(month: str, fallback_month: str | None, min_calls: int,
     return items
 
 
-def asr_stage(calls: list[dict], workdir: str, workers: int) -> dict:
-    """GCS → Soniox для всех звонков (параллельно). Готовые транскрипты копятся в
-    transcripts.jsonl — при перезапуске не распознаются заново. Возвращает {call_id: rec}."""
+def asr_stage(calls: list[dict], workdir: str, workers: int,
+              in_flight: int | None = None, on_ready=None) -> dict:
+    """GCS → Soniox для всех звонков. Готовые транскрипты копятся в
+    transcripts.jsonl — при перезапуске не распознаются заново. Возвращает {call_id: rec}.
+
+    Распознавание идёт через асинхронный SonioxEngine: одно событийное кольцо держит
+    до in_flight (SONIOX_MAX_IN_FLIGHT) распознаваний у вендора, запись течёт из GCS
+    прямо в загрузку. workers — потоки только под кэш транскриптов в БД и чекпоинт.
+    on_ready(call, rec) вызывается по каждому готовому транскрипту — из потока
+    стадии, до её завершения (по нему конвейер отправляет батчи)."""
     path = os.path.join(workdir, "transcripts.jsonl")
     done: dict[str, dict] = {}
     if os.path.exists(path):
@@ -237,20 +293,27 @@ def asr_stage(calls: list[dict], workdir: str, workers: int) -> dict:
     todo = list(calls)
     if not todo:
         return done
-    log(f"ASR: проверяю immutable cache / распознаю {len(todo)} звонков ({workers} параллельно)…")
+    in_flight = in_flight or config.SONIOX_MAX_IN_FLIGHT
+    log(f"ASR: проверяю immutable cache / распознаю {len(todo)} звонков "
+        f"(до {in_flight} у Soniox одновременно, {workers} потоков БД)…")
     lock_write = __import__("threading").Lock()
 
-    def one(call):
+    def lookup(call):
+        """Кэш БД и локальный чекпоинт. Возвращает found: rec — если распознавать не
+        нужно, store — если транскрипт ещё надо положить в кэш."""
         audio_fp = _audio_object_fingerprint(call["id"], call["audio_path"])
         asr_cfg = runtime_store.asr_config()
         asr_cfg_hash = content_hash(asr_cfg)
+        found = {"audio_fp": audio_fp, "asr_cfg": asr_cfg, "asr_cfg_hash": asr_cfg_hash,
+                 "rec": None, "store": True}
         cached = runtime_store.get_transcript(
             call_id=call["id"], audio_fingerprint_value=audio_fp,
             asr_provider="soniox", asr_model=config.SONIOX_MODEL,
             asr_config_hash=asr_cfg_hash, subject_kind=config.SUBJECT_CALL,
         )
         if cached:
-            rec = {
+            found["store"] = False
+            found["rec"] = {
                 "call_id": call["id"], "subject_kind": config.SUBJECT_CALL,
                 "toks": cached.get("tokens") or [],
                 "segments": cached.get("segments") or [],
@@ -262,33 +325,35 @@ def asr_stage(calls: list[dict], workdir: str, workers: int) -> dict:
                 "audio_fingerprint": audio_fp,
                 "asr_config_hash": asr_cfg_hash,
             }
-        else:
-            checkpoint = checkpoints.get(f"{config.SUBJECT_CALL}:{call['id']}") or {}
-            if (checkpoint.get("audio_fingerprint") == audio_fp and
-                    checkpoint.get("asr_config_hash") == asr_cfg_hash and
-                    (checkpoint.get("asm") or {}).get("text")):
-                rec = dict(checkpoint)
-                slim = rec.get("toks") or []
-                asm = rec["asm"]
-            else:
-                with tempfile.TemporaryDirectory() as td:
-                    dest = os.path.join(td, "audio.mp3")
-                    _download(call["audio_path"], dest)
-                    got = soniox.transcribe_file_full(dest)
-                toks, asr_meta = got["tokens"], got["meta"]
-                assembled = soniox.assemble(toks, asr_meta)
-                slim = [{k: t.get(k) for k in (
-                    "text", "speaker", "language", "confidence",
-                    "start_time_ms", "end_time_ms", "is_audio_event") if t.get(k) is not None}
-                        for t in toks]
-                asm = {"text": assembled["text"], "languages": assembled["languages"],
-                       "mean_conf": assembled["mean_conf"],
-                       "low_conf_spans": assembled["low_conf_spans"],
-                       "duration_ms": assembled.get("duration_ms"),
-                       "audio_events": assembled.get("audio_events"),
-                       "asr_meta": asr_meta}
-                rec = {"call_id": call["id"], "subject_kind": config.SUBJECT_CALL,
-                       "toks": slim, "asm": asm}
+            return found
+        checkpoint = checkpoints.get(f"{config.SUBJECT_CALL}:{call['id']}") or {}
+        if (checkpoint.get("audio_fingerprint") == audio_fp and
+                checkpoint.get("asr_config_hash") == asr_cfg_hash and
+                (checkpoint.get("asm") or {}).get("text")):
+            found["rec"] = dict(checkpoint)
+        return found
+
+    def recognized(call, got):
+        toks, asr_meta = got["tokens"], got["meta"]
+        assembled = soniox.assemble(toks, asr_meta)
+        slim = [{k: t.get(k) for k in (
+            "text", "speaker", "language", "confidence",
+            "start_time_ms", "end_time_ms", "is_audio_event") if t.get(k) is not None}
+                for t in toks]
+        asm = {"text": assembled["text"], "languages": assembled["languages"],
+               "mean_conf": assembled["mean_conf"],
+               "low_conf_spans": assembled["low_conf_spans"],
+               "duration_ms": assembled.get("duration_ms"),
+               "audio_events": assembled.get("audio_events"),
+               "asr_meta": asr_meta}
+        return {"call_id": call["id"], "subject_kind": config.SUBJECT_CALL,
+                "toks": slim, "asm": asm}
+
+    def finish(call, found):
+        rec = found["rec"]
+        if found["store"]:
+            slim, asm = rec.get("toks") or [], rec["asm"]
+            audio_fp, asr_cfg_hash = found["audio_fp"], found["asr_cfg_hash"]
             segments = rec.get("segments") or _lines_from_tokens(slim)
             transcript_hash = content_hash(asm["text"])
             duration_ms = asm.get("duration_ms") or max(
@@ -298,7 +363,7 @@ def asr_stage(calls: list[dict], workdir: str, workers: int) -> dict:
                 asr_provider="soniox", asr_model=config.SONIOX_MODEL,
                 asr_config_hash=asr_cfg_hash, transcript_hash=transcript_hash,
                 text=asm["text"], segments=segments, tokens=slim,
-                payload={"asr_config": asr_cfg, "source": "batch",
+                payload={"asr_config": found["asr_cfg"], "source": "batch",
                          "asr_meta": asm.get("asr_meta"), "audio_events": asm.get("audio_events")},
                 languages=asm.get("languages"), mean_conf=asm.get("mean_conf"),
                 low_conf_spans=asm.get("low_conf_spans"), duration_ms=duration_ms,
@@ -314,21 +379,40 @@ def asr_stage(calls: list[dict], workdir: str, workers: int) -> dict:
                 f.write(json.dumps(rec, ensure_ascii=False) + "\n")
         return rec
 
-    ok = fail = 0
-    with ThreadPoolExecutor(max_workers=workers) as ex:
-        futs = {ex.submit(_retry, (lambda c=c: one(c)), tries=2, delay=15,
-                          what=f"ASR call {c['id']}"): c for c in todo}
-        for fu in as_completed(futs):
-            call = futs[fu]
-            cid = call["id"]
-            try:
-                done[_subject_key(call)] = fu.result(); ok += 1
-            except Exception as e:
-                fail += 1
-                log(f"ASR FAIL call={cid}: {e}")
-            if (ok + fail) % 20 == 0:
-                log(f"ASR: {ok + fail}/{len(todo)} (ошибок {fail})")
-    log(f"ASR готово: +{ok}, ошибок {fail}, всего транскриптов {len(done)}")
+    stats = {"ok": 0, "fail": 0}
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            async with soniox_async.SonioxEngine(max_in_flight=in_flight) as engine:
+
+                async def one(call):
+                    found = await loop.run_in_executor(pool, lookup, call)
+                    if found["rec"] is None:
+                        got = await engine.transcribe_gcs(call["audio_path"])
+                        found["rec"] = recognized(call, got)
+                    return await loop.run_in_executor(pool, finish, call, found)
+
+                async def tracked(call):
+                    try:
+                        rec = done[_subject_key(call)] = await _aretry(
+                            lambda: one(call), tries=2, delay=15, what=f"ASR call {call['id']}")
+                        stats["ok"] += 1
+                        if on_ready:
+                            on_ready(call, rec)
+                    except Exception as e:
+                        stats["fail"] += 1
+                        log(f"ASR FAIL call={call['id']}: {e}")
+                    if (stats["ok"] + stats["fail"]) % 20 == 0:
+                        log(f"ASR: {stats['ok'] + stats['fail']}/{len(todo)} "
+                            f"(ошибок {stats['fail']}, у Soniox сейчас {engine.in_flight})")
+
+                await asyncio.gather(*(tracked(c) for c in todo))
+                return engine.peak_in_flight
+
+    peak = asyncio.run(run())
+    log(f"ASR готово: +{stats['ok']}, ошибок {stats['fail']}, всего транскриптов {len(done)} "
+        f"(пик одновременных распознаваний {peak})")
     return done
 
 
@@ -407,11 +491,13 @@ def media_batch_stage(episodes: list[dict], workdir: str) -> int:
     return len(todo)
 
 
-def episode_transcript_stage(episodes: list[dict], workdir: str, workers: int) -> dict:
+def episode_transcript_stage(episodes: list[dict], workdir: str, workers: int,
+                             on_ready=None) -> dict:
     """Транскрипты эпизодов с содержанием вложений → immutable-кэш.
 
     К этому моменту картинки уже описаны батчем; здесь добираются голосовые
-    (Soniox, параллельно) и собирается текст, который увидит модель."""
+    (Soniox, параллельно) и собирается текст, который увидит модель.
+    on_ready(episode, rec) — как у asr_stage."""
     path = os.path.join(workdir, "transcripts.jsonl")
     done: dict[str, dict] = {}
     if not episodes:
@@ -469,7 +555,9 @@ def episode_transcript_stage(episodes: list[dict], workdir: str, workers: int) -
         for fu in as_completed(futs):
             episode = futs[fu]
             try:
-                done[_subject_key(episode)] = fu.result(); ok += 1
+                rec = done[_subject_key(episode)] = fu.result(); ok += 1
+                if on_ready:
+                    on_ready(episode, rec)
             except subjects_mod.SubjectNotEvaluable as exc:
                 fail += 1
                 log(f"эпизод {episode['id']} пропущен: {exc}")
@@ -614,13 +702,13 @@ def poll_batch(batch_id: str, interval: int = 30) -> dict:
         try:
             st = _retry(_get, what="статус батча")
         except Exception as e:
-            log(f"статус батча недоступен ({e}) — продолжаю ждать")
+            log(f"статус батча {batch_id} недоступен ({e}) — продолжаю ждать")
             time.sleep(interval)
             continue
         if st.get("processing_status") == "ended":
-            log(f"батч завершён: {st.get('request_counts')}")
+            log(f"батч {batch_id} завершён: {st.get('request_counts')}")
             return st
-        log(f"батч в работе: {st.get('request_counts')}")
+        log(f"батч {batch_id} в работе: {st.get('request_counts')}")
         time.sleep(interval)
 
 
@@ -630,7 +718,11 @@ def process_results(batch: dict, calls: list[dict], transcripts: dict, workdir:
     if manifest is None:
         raise RuntimeError("Batch results cannot be processed without the frozen manifest")
     expected = set(manifest["entries"])
-    terminal = set()
+    # Поштучный чекпоинт: субъекты, уже опубликованные до обрыва, при повторном
+    # разборе не проходят финализацию заново.
+    terminal = {item["custom_id"] for item in _done_items(workdir)}
+    if terminal:
+        log(f"разбор батча продолжается: {len(terminal & expected)} результатов уже опубликовано")
     usage_tot = {"input": 0, "output": 0, "cache_write": 0, "cache_read": 0}
     stats = {"ok": 0, "errored": 0, "no_score": 0, "pairs": []}
 
@@ -645,6 +737,8 @@ def process_results(batch: dict, calls: list[dict], transcripts: dict, workdir:
         entry = manifest["entries"].get(custom_id)
         if entry is None:
             raise RuntimeError(f"unexpected Batch result custom_id={custom_id!r}")
+        if custom_id in terminal:
+            continue
         cid = int(entry["call"]["id"])
         call = entry["call"]
         subject_kind = (entry.get("subject_kind")
@@ -719,6 +813,7 @@ def process_results(batch: dict, calls: list[dict], transcripts: dict, workdir:
                                           subject_kind=subject_kind),
                        what=f"восстановление кэша {subject_kind} {cid}")
                 _meta_upsert(cid, cache_model, compatibility, subject_kind=subject_kind)
+                _mark_done(workdir, custom_id, call)
                 terminal.add(custom_id)
                 continue
             run_id = runtime_store.new_run_id()
@@ -832,6 +927,7 @@ def process_results(batch: dict, calls: list[dict], transcripts: dict, workdir:
                                       subject_kind=subject_kind),
                    what=f"запись кэша {subject_kind} {cid}")
             _meta_upsert(cid, cache_model, payload, subject_kind=subject_kind)
+            _mark_done(workdir, custom_id, call)
             terminal.add(custom_id)
             stats["ok"] += 1
             if score is None:
@@ -844,12 +940,165 @@ def process_results(batch: dict, calls: list[dict], transcripts: dict, workdir:
     missing_results = expected - terminal
     if missing_results:
         raise RuntimeError(f"Batch results incomplete; missing terminal runs: {sorted(missing_results)}")
+    # журнал уходит первым: при обрыве посреди уборки повторный разбор идёт по
+    # идемпотентной ветке already, а не пропускает субъекты чужого манифеста
+    if os.path.exists(_done_path(workdir)):
+        os.remove(_done_path(workdir))
     os.remove(os.path.join(workdir, "batch_id.txt"))
     os.remove(_manifest_path(workdir))
     stats["usage"] = usage_tot
     return stats
 
 
+def _chunk_dirs(workdir: str) -> list[str]:
+    """Порции конвейера с незавершённым манифестом — их продолжают при перезапуске.
+    Манифест прежнего однобатчевого прогона лежит прямо в workdir и идёт первым."""
+    found = [workdir] if os.path.exists(_manifest_path(workdir)) else []
+    root = os.path.join(workdir, "batches")
+    if os.path.isdir(root):
+        found += [os.path.join(root, name) for name in sorted(os.listdir(root))
+                  if os.path.exists(_manifest_path(os.path.join(root, name)))]
+    return found
+
+
+def _chunk_subjects(chunk_dir: str) -> set[str]:
+    manifest = _load_manifest(chunk_dir) or {"entries": {}}
+    return ({_subject_key(entry["call"]) for entry in manifest["entries"].values()} |
+            {item["subject"] for item in _done_items(chunk_dir) if item.get("subject")})
+
+
+def _merge_stats(total: dict, part: dict) -> None:
+    for key in ("ok", "errored", "no_score"):
+        total[key] += part.get(key, 0)
+    total["pairs"].extend(part.get("pairs") or [])
+    for key, value in (part.get("usage") or {}).items():
+        total["usage"][key] = total["usage"].get(key, 0) + value
+
+
+def _finish_chunk(chunk_dir: str, batch_id: str, transcripts: dict, get_dir) -> dict:
+    batch = poll_batch(batch_id)
+    stats = process_results(batch, [], transcripts, chunk_dir, get_dir)
+    _drop_chunk_dir(chunk_dir)
+    return stats
+
+
+def _drop_chunk_dir(chunk_dir: str) -> None:
+    """Пустая папка порции больше не нужна; сам workdir (старый прогон) не трогаем."""
+    if os.path.basename(os.path.dirname(chunk_dir)) == "batches":
+        try:
+            os.rmdir(chunk_dir)
+        except OSError:
+            pass
+
+
+def pipeline(workdir: str, produce, *, batch_size: int | None = None,
+             linger_s: float | None = None, open_batches: int | None = None) -> dict:
+    """Транскрипты → батчи оценок → разбор результатов одним конвейером.
+
+    produce(on_ready) — стадия транскриптов (asr_stage / episode_transcript_stage),
+    она работает в отдельном потоке и отдаёт каждый готовый транскрипт. Основной
+    поток копит их и отправляет батч порцией batch_size (или раньше, если первый
+    субъект порции ждёт дольше linger_s); каждый отправленный батч ждёт и
+    разбирается в своём потоке, пока распознаются следующие. Время прогона — около
+    самой долгой стадии, а не их суммы.
+
+    Каждая порция — своя папка batches/NNNN с frozen manifest, batch_id.txt и
+    поштучным журналом batch_done.jsonl. При перезапуске незавершённые порции
+    продолжаются (отправка, ожидание или разбор с места обрыва), а их субъекты не
+    попадают в новые порции."""
+    batch_size = max(1, int(batch_size or config.BATCH_CHUNK_SIZE))
+    linger_s = config.BATCH_LINGER_S if linger_s is None else float(linger_s)
+    open_batches = max(1, int(open_batches or config.BATCH_OPEN_MAX))
+    root = os.path.join(workdir, "batches")
+    os.makedirs(root, exist_ok=True)
+    get_dir = _dir_cache()
+    transcripts: dict[str, dict] = {}
+    stats = {"ok": 0, "errored": 0, "no_score": 0, "pairs": [],
+             "usage": {"input": 0, "output": 0, "cache_write": 0, "cache_read": 0},
+             "failed_batches": 0}
+    resume = _chunk_dirs(workdir)
+    claimed: set[str] = set()
+    for chunk_dir in resume:
+        claimed |= _chunk_subjects(chunk_dir)
+    if resume:
+        log(f"конвейер: продолжаю {len(resume)} незавершённых порций ({len(claimed)} субъектов)")
+    numbers = [int(name) for name in os.listdir(root) if name.isdigit()]
+    next_number = [max(numbers, default=0) + 1]
+    ready: queue.Queue = queue.Queue()
+    finished = object()
+
+    def on_ready(subject, rec):
+        ready.put((subject, rec))
+
+    def producer():
+        try:
+            produce(on_ready)
+        except Exception as exc:
+            log(f"стадия транскриптов оборвалась: {exc}")
+        finally:
+            ready.put((finished, None))
+
+    with ThreadPoolExecutor(max_workers=open_batches) as pool:
+        running = {}
+
+        def launch(chunk_dir, chunk_calls):
+            try:
+                bid = submit_batch(chunk_calls, transcripts, chunk_dir, get_dir)
+            except Exception as exc:
+                stats["failed_batches"] += 1
+                log(f"порция {chunk_dir}: отправка не удалась ({exc}) — продолжится при перезапуске")
+                return
+            if bid:
+                running[pool.submit(_finish_chunk, chunk_dir, bid, transcripts, get_dir)] = chunk_dir
+            else:
+                _drop_chunk_dir(chunk_dir)
+
+        for chunk_dir in resume:
+            launch(chunk_dir, [])
+
+        def flush(chunk):
+            chunk_dir = os.path.join(root, f"{next_number[0]:04d}")
+            next_number[0] += 1
+            os.makedirs(chunk_dir, exist_ok=True)
+            log(f"конвейер: порция {os.path.basename(chunk_dir)} — {len(chunk)} субъектов")
+            launch(chunk_dir, chunk)
+
+        thread = threading.Thread(target=producer, name="batch-eval-transcripts", daemon=True)
+        thread.start()
+        pending, first_at, done = [], None, False
+        while not done:
+            try:
+                subject, rec = ready.get(timeout=5)
+            except queue.Empty:
+                subject = rec = None
+            if subject is finished:
+                done = True
+            elif subject is not None:
+                key = _subject_key(subject)
+                transcripts[key] = rec
+                if key not in claimed:
+                    claimed.add(key)
+                    pending.append(subject)
+                    first_at = first_at or time.monotonic()
+            while len(pending) >= batch_size:
+                flush(pending[:batch_size])
+                pending = pending[batch_size:]
+                first_at = time.monotonic() if pending else None
+            if pending and (done or time.monotonic() - first_at >= linger_s):
+                flush(pending)
+                pending, first_at = [], None
+        thread.join()
+
+        for fu in as_completed(list(running)):
+            chunk_dir = running[fu]
+            try:
+                _merge_stats(stats, fu.result())
+            except Exception as exc:
+                stats["failed_batches"] += 1
+                log(f"порция {chunk_dir}: разбор не завершён ({exc}) — продолжится при перезапуске")
+    return stats
+
+
 def main():
     ap = argparse.ArgumentParser(description="Пакетная ИИ-оценка через Batch API")
     ap.add_argument("--subject", choices=list(config.SUBJECT_KINDS),
@@ -859,7 +1108,16 @@ def main():
     ap.add_argument("--fallback-month", help="добрать из этого месяца, если мало")
     ap.add_argument("--min-calls", type=int, default=50)
     ap.add_argument("--limit", type=int)
-    ap.add_argument("--asr-workers", type=int, default=6)
+    ap.add_argument("--asr-workers", type=int, default=6,
+                    help="потоки под кэш транскриптов в БД (и ASR эпизодов)")
+    ap.add_argument("--asr-in-flight", type=int, default=config.SONIOX_MAX_IN_FLIGHT,
+                    help="потолок одновременных распознаваний звонков у Soniox")
+    ap.add_argument("--batch-size", type=int, default=config.BATCH_CHUNK_SIZE,
+                    help="субъектов в одном батче оценок конвейера")
+    ap.add_argument("--batch-linger", type=float, default=config.BATCH_LINGER_S,
+                    help="через сколько секунд отправлять неполную порцию")
+    ap.add_argument("--open-batches", type=int, default=config.BATCH_OPEN_MAX,
+                    help="сколько батчей одновременно ждать и разбирать")
     ap.add_argument("--workdir", help="папка стадий (для перезапуска); по умолчанию во временной")
     ap.add_argument("--dry-run", action="store_true", help="только выборка, без ASR/LLM")
     args = ap.parse_args()
@@ -879,25 +1137,27 @@ def main():
         calls = select_episodes(args.month, args.fallback_month, args.min_calls, args.limit)
     else:
         calls = select_calls(args.month, args.fallback_month, args.min_calls, args.limit)
-    if not calls:
+    if not calls and not _chunk_dirs(workdir):
         log("нечего оценивать — всё уже в кэше"); return
     if args.dry_run:
         log(f"dry-run: к оценке {len(calls)} субъектов ({subject_kind})"); return
 
     if subject_kind == config.SUBJECT_WZ_EPISODE:
-        # Сначала ОДИН батч описаний картинок (−50%), потом транскрипты с их содержанием.
-        media_batch_stage(calls, workdir)
-        transcripts = episode_transcript_stage(calls, workdir, args.asr_workers)
+        def produce(on_ready):
+            # Сначала ОДИН батч описаний картинок (−50%), потом транскрипты с их содержанием.
+            media_batch_stage(calls, workdir)
+            return episode_transcript_stage(calls, workdir, args.asr_workers, on_ready=on_ready)
     else:
-        transcripts = asr_stage(calls, workdir, args.asr_workers)
-    bid = submit_batch(calls, transcripts, workdir, get_dir := _dir_cache())
-    if not bid:
-        return
-    batch = poll_batch(bid)
-    stats = process_results(batch, calls, transcripts, workdir, get_dir)
+        def produce(on_ready):
+            return asr_stage(calls, workdir, args.asr_workers, args.asr_in_flight,
+                             on_ready=on_ready)
+    stats = pipeline(workdir, produce, batch_size=args.batch_size,
+                     linger_s=args.batch_linger, open_batches=args.open_batches)
 
     u = stats["usage"]
     log(f"\nИТОГ: оценено {stats['ok']} (ошибок батча {stats['errored']}, без балла {stats['no_score']})")
+    if stats["failed_batches"]:
+        log(f"незавершённых порций: {stats['failed_batches']} — перезапустите с тем же --workdir")
     if stats["pairs"]:
         diffs = [abs(h - a) for h, a in stats["pairs"]]
         exact = sum(1 for d in diffs if d <= 5)
@@ -3,6 +3,7 @@
 import os
 import json
 import functools
+import threading
 
 _ENV_FILE = os.path.join(os.path.dirname(__file__), os.pardir, ".env.codex.local")
 
@@ -82,6 +83,13 @@ SONIOX_MODEL = "stt-async-v5"
 SONIOX_LANGS = ["kk", "ru"]
 ASR_CONF_SOFT = 0.70   # подсветка неуверенного токена
 ASR_CONF_HARD = 0.50   # «реальный» неуверенный спан
+# Асинхронный клиент (пакетный прогон): глобальный потолок одновременных
+# распознаваний у вендора и адаптивный опрос статуса — от первой паузы с ростом
+# в 1.5 раза до максимальной. Срок — на одно распознавание с загрузкой.
+SONIOX_MAX_IN_FLIGHT = int(env("SONIOX_MAX_IN_FLIGHT", "64"))
+SONIOX_POLL_INITIAL_S = float(env("SONIOX_POLL_INITIAL_S", "1"))
+SONIOX_POLL_MAX_S = float(env("SONIOX_POLL_MAX_S", "15"))
+SONIOX_ASYNC_TIMEOUT_S = float(env("SONIOX_ASYNC_TIMEOUT_S", "900"))
 
 # --- Эмбеддинги / retrieval ---
 EMBEDDINGS_PROVIDER = str(env("EMBEDDINGS_PROVIDER", "vertex")).strip().lower()  # vertex | selfhost
@@ -117,6 +125,13 @@ CLAUDE_EFFORT = env("CLAUDE_EFFORT", "high")
 # Пустое значение возвращает дефолтные 5 минут (для интерактивной оценки так и надо:
 # одиночный вызов не окупает удвоенную запись).
 CLAUDE_CACHE_TTL_BATCH = env("CLAUDE_CACHE_TTL_BATCH", "1h") or None
+# Конвейер batch_eval: готовые транскрипты уходят в Batch API порциями по
+# BATCH_CHUNK_SIZE, неполная порция отправляется, если первый её субъект ждёт
+# дольше BATCH_LINGER_S. BATCH_OPEN_MAX — сколько батчей одновременно ждём и
+# разбираем; остальные уже отправлены и ждут своей очереди на разбор.
+BATCH_CHUNK_SIZE = int(env("CALL_QA_BATCH_CHUNK_SIZE", "200"))
+BATCH_LINGER_S = float(env("CALL_QA_BATCH_LINGER_S", "600"))
+BATCH_OPEN_MAX = int(env("CALL_QA_BATCH_OPEN_MAX", "8"))
 
 
 def anthropic_key():
@@ -200,21 +215,75 @@ def _connect_pg():
     return psycopg2.connect(**kw)
 
 
-def connect_ro():
-    """Чтение: локально DATABASE_URL_READONLY, на проде POSTGRES_* (полный доступ, сессия read-only)."""
+# Пулы соединений (см. pg_pool.py): потолок на процесс, сколько ждать места, когда
+# проверять простоявшее соединение и когда менять его на новое.
+PG_POOL_RO_MAX = int(env("CALL_QA_PG_POOL_RO_MAX", "8"))
+PG_POOL_RW_MAX = int(env("CALL_QA_PG_POOL_RW_MAX", "6"))
+PG_POOL_ACQUIRE_TIMEOUT_S = float(env("CALL_QA_PG_POOL_ACQUIRE_TIMEOUT_S", "30"))
+PG_POOL_PING_AFTER_S = float(env("CALL_QA_PG_POOL_PING_AFTER_S", "30"))
+PG_POOL_MAX_LIFETIME_S = float(env("CALL_QA_PG_POOL_MAX_LIFETIME_S", "1800"))
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _open_ro():
     import psycopg2
     url = env("DATABASE_URL_READONLY")
-    conn = psycopg2.connect(url) if url else _connect_pg()
-    conn.set_session(readonly=True, autocommit=True)
-    return conn
+    return psycopg2.connect(url) if url else _connect_pg()
 
 
-def connect_rw():
-    """Запись: DATABASE_URL или POSTGRES_* (полный доступ). Локально (только RO) бросит ошибку."""
+def _open_rw():
     import psycopg2
     url = env("DATABASE_URL")
     return psycopg2.connect(url) if url else _connect_pg()
 
+
+def _pool(kind):
+    with _pools_lock:
+        found = _pools.get(kind)
+        if found is None:
+            from .pg_pool import ConnectionPool
+            if kind == "ro":
+                found = ConnectionPool("ro", _open_ro, max_size=PG_POOL_RO_MAX,
+                                       autocommit=True, readonly=True,
+                                       acquire_timeout_seconds=PG_POOL_ACQUIRE_TIMEOUT_S,
+                                       ping_after_seconds=PG_POOL_PING_AFTER_S,
+                                       max_lifetime_seconds=PG_POOL_MAX_LIFETIME_S)
+            else:
+                found = ConnectionPool("rw", _open_rw, max_size=PG_POOL_RW_MAX,
+                                       acquire_timeout_seconds=PG_POOL_ACQUIRE_TIMEOUT_S,
+                                       ping_after_seconds=PG_POOL_PING_AFTER_S,
+                                       max_lifetime_seconds=PG_POOL_MAX_LIFETIME_S)
+            _pools[kind] = found
+        return found
+
+
+def connect_ro():
+    """Чтение: локально DATABASE_URL_READONLY, на проде POSTGRES_* (полный доступ, сессия read-only).
+
+    Соединение из пула: close() возвращает его туда."""
+    return _pool("ro").connection()
+
+
+def connect_rw(pooled=True):
+    """Запись: DATABASE_URL или POSTGRES_* (полный доступ). Локально (только RO) бросит ошибку.
+
+    pooled=False — отдельное соединение мимо пула: для сессионных ресурсов, которые
+    держатся всю оценку (advisory lock), чтобы они не занимали места пула."""
+    if not pooled:
+        conn = _open_rw()
+        conn.set_client_encoding("UTF8")
+        return conn
+    return _pool("rw").connection()
+
+
+def pg_pool_stats() -> dict:
+    """Сводка пулов соединений call_qa: открыто, переиспользовано, выброшено, ожидания."""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {kind: pool.stats() for kind, pool in pools.items()}
+
 # --- Ревью ---
 REVIEW_MODEL_CONF = 0.60   # ниже — на ревью
 RETRIEVAL_TOP_K = int(env("RETRIEVAL_TOP_K", "3"))
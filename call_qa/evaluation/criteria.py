@@ -67,7 +67,7 @@ def load_direction(direction_id: int) -> dict:
     подтягивают актуальные критерии/веса. ``row_id`` — строка, из которой
     реально загружены критерии (после редиректа на каноническую)."""
     conn = config.connect_ro()
-    cur = conn.cursor(); cur.execute("SET client_encoding TO 'UTF8'")
+    cur = conn.cursor()
     cur.execute("SELECT id, name, criteria, canonical_id FROM directions WHERE id=%s", (direction_id,))
     row = cur.fetchone()
     if not row:
@@ -58,8 +58,9 @@ def distributed_call_lock(call_id: int, *, subject_kind: str = config.SUBJECT_CA
     classid = _LOCK_CLASSID.get(subject_kind, 71623)
     try:
         # Advisory locks must live on the same primary that stores runs/cases;
-        # a read replica would provide a different lock namespace.
-        conn = config.connect_rw()
+        # a read replica would provide a different lock namespace. The session
+        # holds the lock for the whole evaluation, so it stays outside the pool.
+        conn = config.connect_rw(pooled=False)
         cur = conn.cursor()
         cur.execute("SELECT pg_advisory_lock(%s,%s)", (classid, int(call_id)))
         acquired = True
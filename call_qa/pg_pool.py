@@ -0,0 +1,223 @@
+"""Пул соединений call_qa с Postgres: ограниченный, с проверкой живости, RO и RW отдельно.
+
+config.connect_ro()/connect_rw() открывали новое соединение на каждый вызов, а
+таких мест под восемьдесят. Одна оценка звонка (_evaluate_and_cache) открывала
+их пять-шесть подряд — контекст знаний, кэш, транскрипт, сохранение прогона,
+трасса retrieval, — и каждое стоило TLS-рукопожатия с managed Postgres. Пакетный
+прогон с несколькими воркерами мог открыть соединений больше, чем разрешает
+сервер.
+
+Пул отдаёт ту же привычную вызывающему коду вещь: объект соединения psycopg2.
+close() возвращает соединение в пул, а не закрывает его, поэтому места вызова
+не меняются. Возвращая, пул откатывает незавершённую транзакцию — как это
+делал бы настоящий close() — и восстанавливает autocommit/readonly, если их
+поменяли. Настройки соединения (client_encoding, режим сессии) применяются
+один раз, при открытии.
+
+Живость: соединение, пролежавшее без дела дольше ping_after_seconds, перед
+выдачей проверяется SELECT 1; упавшее и отслужившее max_lifetime_seconds
+закрывается. Соединение, на котором запрос оборвался (psycopg2 помечает его
+closed), в пул не возвращается.
+
+Предел: не больше max_size соединений на пул; лишний запрос ждёт
+acquire_timeout_seconds и получает TimeoutError — очередь вместо отказа
+сервера «too many connections». Долгоживущие сессионные ресурсы (advisory lock
+на всё время оценки) берут соединение мимо пула, иначе они съедали бы места.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PooledConnection:
+    """Соединение из пула: всё — как у psycopg2, только close() возвращает его в пул."""
+
+    __slots__ = ("_pool", "_raw", "_created_at", "_released")
+
+    def __init__(self, pool, raw, created_at):
+        object.__setattr__(self, "_pool", pool)
+        object.__setattr__(self, "_raw", raw)
+        object.__setattr__(self, "_created_at", created_at)
+        object.__setattr__(self, "_released", False)
+
+    def _conn(self):
+        if self._released:
+            raise psycopg2.InterfaceError("connection already closed")
+        return self._raw
+
+    def __getattr__(self, name):
+        return getattr(self._conn(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn(), name, value)
+
+    @property
+    def closed(self):
+        return 1 if self._released else self._raw.closed
+
+    def close(self):
+        if self._released:
+            return
+        object.__setattr__(self, "_released", True)
+        self._pool._release(self._raw, self._created_at)
+
+    def __enter__(self):
+        # Как у psycopg2: with conn — одна транзакция (commit/rollback), соединение не закрывается.
+        self._conn()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        conn = self._conn()
+        if exc_type is None:
+            conn.commit()
+        else:
+            conn.rollback()
+        return False
+
+    def __del__(self):
+        # Забытый close(): соединение всё равно вернётся, а не уйдёт из пула навсегда.
+        try:
+            if not self._released:
+                self.close()
+        except Exception:  # noqa: BLE001 — в __del__ исключения некуда отдавать
+            pass
+
+
+class ConnectionPool:
+    """Пул соединений одного вида (RO или RW). Потокобезопасен."""
+
+    def __init__(self, name, connect, *, max_size=4, autocommit=False, readonly=False,
+                 acquire_timeout_seconds=30.0, ping_after_seconds=30.0,
+                 max_lifetime_seconds=1800.0, clock=time.monotonic):
+        self.name = name
+        self._connect = connect
+        self.max_size = max(1, int(max_size))
+        self.autocommit = bool(autocommit)
+        self.readonly = bool(readonly)
+        self.acquire_timeout_seconds = float(acquire_timeout_seconds)
+        self.ping_after_seconds = float(ping_after_seconds)
+        self.max_lifetime_seconds = float(max_lifetime_seconds)
+        self._clock = clock
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._lock = threading.Lock()
+        self._idle = deque()  # (raw, created_at, returned_at); свежие справа
+        self._stats = {"opened": 0, "reused": 0, "discarded": 0, "timeouts": 0,
+                       "in_use": 0, "wait_max_seconds": 0.0}
+
+    # ── выдача ──────────────────────────────────────────────────────────────
+    def connection(self):
+        """Соединение из пула (или новое). Ждёт свободного места не дольше acquire_timeout."""
+        started = self._clock()
+        if not self._slots.acquire(timeout=self.acquire_timeout_seconds):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise TimeoutError(f"CALL_QA_POOL_ACQUIRE_TIMEOUT ({self.name}, max={self.max_size})")
+        waited = self._clock() - started
+        try:
+            raw, created_at = self._checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._stats["in_use"] += 1
+            self._stats["wait_max_seconds"] = max(self._stats["wait_max_seconds"], waited)
+        return PooledConnection(self, raw, created_at)
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                item = self._idle.pop() if self._idle else None
+            if item is None:
+                return self._open(), self._clock()
+            raw, created_at, returned_at = item
+            now = self._clock()
+            if raw.closed or now - created_at >= self.max_lifetime_seconds:
+                self._discard(raw)
+                continue
+            if now - returned_at >= self.ping_after_seconds and not self._alive(raw):
+                self._discard(raw)
+                continue
+            with self._lock:
+                self._stats["reused"] += 1
+            return raw, created_at
+
+    def _open(self):
+        raw = self._connect()
+        try:
+            raw.set_client_encoding("UTF8")
+            raw.set_session(readonly=self.readonly or None, autocommit=self.autocommit)
+        except BaseException:
+            raw.close()
+            raise
+        with self._lock:
+            self._stats["opened"] += 1
+        return raw
+
+    @staticmethod
+    def _alive(raw):
+        try:
+            cur = raw.cursor()
+            try:
+                cur.execute("SELECT 1")
+            finally:
+                cur.close()
+            if not raw.autocommit:
+                raw.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    # ── возврат ─────────────────────────────────────────────────────────────
+    def _release(self, raw, created_at):
+        try:
+            if not raw.closed and self._tidy(raw):
+                with self._lock:
+                    self._idle.append((raw, created_at, self._clock()))
+            else:
+                self._discard(raw)
+        finally:
+            with self._lock:
+                self._stats["in_use"] -= 1
+            self._slots.release()
+
+    def _tidy(self, raw):
+        """Привести соединение к виду «как новое»: без транзакции и с режимом пула."""
+        try:
+            if raw.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                raw.rollback()
+            if raw.autocommit != self.autocommit:
+                raw.autocommit = self.autocommit
+            if bool(raw.readonly) != self.readonly:
+                raw.readonly = self.readonly or None
+            return raw.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        except psycopg2.Error as exc:
+            logging.info("call_qa pg pool %s: соединение не вернуть в пул: %s", self.name, exc)
+            return False
+
+    def _discard(self, raw):
+        with self._lock:
+            self._stats["discarded"] += 1
+        try:
+            raw.close()
+        except Exception:  # noqa: BLE001 — закрываем уже негодное
+            pass
+
+    # ── обслуживание ────────────────────────────────────────────────────────
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for raw, _created_at, _returned_at in idle:
+            try:
+                raw.close()
+            except Exception:  # noqa: BLE001
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {"max_size": self.max_size, "idle": len(self._idle), **self._stats}
@@ -238,6 +238,13 @@ def apply_on_startup():
         logging.info("call_qa schema: применено %d, пропущено %d", len(applied), len(skipped))
         for head, err in skipped:
             logging.warning("call_qa schema пропущено: %s :: %s", head, err)
+        try:
+            from ..review.queue import backfill_queue_index
+            filled = backfill_queue_index(conn)
+            if filled:
+                logging.info("call_qa: очередь ревью — досчитан приоритет %d карточек", filled)
+        except Exception:
+            logging.exception("call_qa: не удалось досчитать индекс очереди ревью")
     except Exception:
         logging.exception("call_qa schema: ошибка применения")
         if config.RAG_TRACE_REQUIRED:
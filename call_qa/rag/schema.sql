@@ -1228,3 +1228,101 @@ $qa$;
 DROP TRIGGER IF EXISTS qa_rule_embedding_change_guard ON qa_policy_rule_embeddings;
 CREATE TRIGGER qa_rule_embedding_change_guard BEFORE UPDATE OR DELETE ON qa_policy_rule_embeddings
     FOR EACH ROW EXECUTE FUNCTION qa_guard_rule_embedding_change();
+
+-- ═══ Очередь ревью: приоритет и порядок считаются при записи ═══════════════════
+-- Раньше review_queue_list читал до 3000 карточек кэша с LATERAL по прогонам,
+-- считал причины в Python и сортировал их там же — открытие очереди стоило
+-- пропорционально числу оценок. Теперь причины, приоритет (позиция самой
+-- серьёзной причины в REASON_PRIORITY, 5 — без причин), момент постановки в
+-- очередь и identity последнего прогона пишутся в мету вместе с оценкой
+-- (_meta_upsert), а очередь — один проход по частичному индексу в порядке
+-- выдачи с keyset-пагинацией. Проверенные (review_outcome задан) из индекса
+-- выпадают сами.
+ALTER TABLE ai_evaluation_meta ADD COLUMN IF NOT EXISTS review_priority smallint;
+ALTER TABLE ai_evaluation_meta ADD COLUMN IF NOT EXISTS queued_at timestamptz;
+ALTER TABLE ai_evaluation_meta ADD COLUMN IF NOT EXISTS run_fingerprint text;
+ALTER TABLE ai_evaluation_meta ADD COLUMN IF NOT EXISTS run_transcript_hash text;
+
+CREATE INDEX IF NOT EXISTS idx_ai_eval_review_queue
+    ON ai_evaluation_meta (model, review_priority, queued_at DESC, subject_kind, call_id)
+    WHERE review_outcome IS NULL;
+
+-- Догонка уже записанной меты. review_reasons хранятся упорядоченными по
+-- серьёзности, поэтому приоритет — позиция первой причины. Порядок — прежний:
+-- время записи карточки кэша. Карточки без меты (до журнала ревью) досчитывает
+-- review.queue.backfill_queue_index на старте: причины нужны по правилам из кода.
+UPDATE ai_evaluation_meta m
+   SET review_priority = CASE m.review_reasons->>0
+                             WHEN 'critical' THEN 0 WHEN 'lowconf' THEN 1
+                             WHEN 'pending' THEN 2 WHEN 'asr' THEN 3 WHEN 'media' THEN 4
+                             ELSE 5 END,
+       queued_at = COALESCE(
+           (SELECT rc.created_at FROM ai_review_cache rc
+             WHERE rc.subject_kind = m.subject_kind AND rc.call_id = m.call_id
+               AND rc.model = m.model),
+           m.created_at)
+ WHERE m.review_outcome IS NULL AND m.review_priority IS NULL
+   AND m.review_reasons IS NOT NULL;
+
+UPDATE ai_evaluation_meta m
+   SET (run_fingerprint, run_transcript_hash) = (
+       SELECT r.evaluation_fingerprint::text, r.fingerprint_components->>'transcript_hash'
+         FROM ai_evaluation_runs r
+        WHERE r.subject_kind = m.subject_kind AND r.call_id = m.call_id
+          AND r.status = 'succeeded' AND r.run_kind IN ('standard','force','batch')
+        ORDER BY r.created_at DESC, r.id::text DESC
+        LIMIT 1)
+ WHERE m.review_outcome IS NULL AND m.run_fingerprint IS NULL;
+
+-- ═══ Сводки метрик доверия (call_qa/review/rollups.py) ══════════════════════════
+-- Дашборд «ИИ-оценка» складывает готовые дневные сводки вместо полного прохода
+-- по кэшу карточек и человеческим оценкам. qa_trust_facts — последний учтённый
+-- вклад субъекта: по нему сводки сдвигаются дельтой при переоценке и ревью.
+-- qa_trust_rollup_state — отметка завершённой пересборки (backfill); без неё
+-- дашборд считает полным пересчётом.
+CREATE TABLE IF NOT EXISTS qa_trust_facts (
+    subject_kind   text NOT NULL,
+    call_id        bigint NOT NULL,
+    verdict_cells  jsonb NOT NULL DEFAULT '[]'::jsonb,
+    review_cells   jsonb NOT NULL DEFAULT '[]'::jsonb,
+    updated_at     timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (subject_kind, call_id)
+);
+
+CREATE TABLE IF NOT EXISTS qa_trust_verdict_rollups (
+    day            date NOT NULL,
+    direction_id   integer NOT NULL,
+    direction      text NOT NULL,
+    criterion      text NOT NULL,
+    model          text NOT NULL,
+    subject_kind   text NOT NULL,
+    human_verdict  text NOT NULL,
+    ai_verdict     text NOT NULL,
+    n              integer NOT NULL DEFAULT 0,
+    updated_at     timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (day, direction_id, direction, criterion, model, subject_kind,
+                 human_verdict, ai_verdict)
+);
+CREATE INDEX IF NOT EXISTS idx_qa_trust_verdict_rollups_direction
+    ON qa_trust_verdict_rollups (direction_id, day);
+
+CREATE TABLE IF NOT EXISTS qa_trust_review_rollups (
+    day            date NOT NULL,
+    direction_id   integer NOT NULL,
+    model          text NOT NULL,
+    subject_kind   text NOT NULL,
+    confirmed      integer NOT NULL DEFAULT 0,
+    adjudicated    integer NOT NULL DEFAULT 0,
+    endorsed       integer NOT NULL DEFAULT 0,
+    corrected      integer NOT NULL DEFAULT 0,
+    alarms         integer NOT NULL DEFAULT 0,
+    alarm_hits     integer NOT NULL DEFAULT 0,
+    updated_at     timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (day, direction_id, model, subject_kind)
+);
+
+CREATE TABLE IF NOT EXISTS qa_trust_rollup_state (
+    id         integer PRIMARY KEY,
+    built_at   timestamptz NOT NULL,
+    subjects   integer NOT NULL DEFAULT 0
+);
@@ -242,7 +242,6 @@ def _adjudication_source(adj_id: int) -> dict | None:
     conn = config.connect_rw()
     try:
         with conn.cursor() as cur:
-            cur.execute("SET client_encoding TO 'UTF8'")
             cur.execute(f"""SELECT {', '.join(_ADJ_SNAPSHOT_FIELDS)}
                               FROM qa_adjudications
                              WHERE id=%s AND is_active""", (adj_id,))
@@ -269,7 +268,6 @@ def _write_adjudication(adj_id: int, fields: dict, *, vec=None, source: dict | N
     conn = config.connect_rw()
     try:
         with conn, conn.cursor() as cur:
-            cur.execute("SET client_encoding TO 'UTF8'")
             cur.execute(f"UPDATE qa_adjudications SET {sets} WHERE {where} RETURNING id", params)
             return cur.fetchone() is not None
     finally:
@@ -35,6 +35,56 @@ def review_reasons(criteria, asr_mean_conf=None, media_stats=None) -> list[str]:
     return [r for r in REASON_PRIORITY if r in reasons]
 
 
+def review_priority(reasons) -> int:
+    """Ключ сортировки очереди: позиция самой серьёзной причины в REASON_PRIORITY,
+    без причин — len(REASON_PRIORITY) (в конец). Считается при записи меты и лежит в
+    индексированной колонке ai_evaluation_meta.review_priority."""
+    return min((REASON_PRIORITY.index(r) for r in reasons or [] if r in REASON_PRIORITY),
+               default=len(REASON_PRIORITY))
+
+
+def backfill_queue_index(conn, batch: int = 500) -> int:
+    """Досчитать review_priority/queued_at для непроверенных строк, где их нет: старые
+    карточки кэша без меты (до журнала ревью) и мета, записанная прошлой версией кода
+    во время rolling deploy. Причины — из сохранённой карточки по тем же правилам, что
+    и при записи. Идемпотентно; возвращает число обработанных строк."""
+    from psycopg2.extras import Json
+    done = 0
+    while True:
+        with conn, conn.cursor() as cur:
+            cur.execute(
+                """SELECT rc.subject_kind, rc.call_id, rc.model, rc.payload, rc.created_at
+                     FROM ai_review_cache rc
+                     LEFT JOIN ai_evaluation_meta m
+                            ON m.subject_kind = rc.subject_kind AND m.call_id = rc.call_id
+                               AND m.model = rc.model
+                    WHERE m.id IS NULL
+                       OR (m.review_outcome IS NULL AND m.review_priority IS NULL)
+                    LIMIT %s""",
+                (int(batch),))
+            rows = cur.fetchall()
+            for kind, call_id, model, payload, created_at in rows:
+                payload = payload or {}
+                reasons = review_reasons(payload.get("criteria"), payload.get("asr_mean_conf"),
+                                         payload.get("media") or {})
+                cur.execute(
+                    """INSERT INTO ai_evaluation_meta
+                         (subject_kind, call_id, direction_id, model, per_criterion,
+                          asr_mean_conf, needs_review, review_reasons, review_priority, queued_at)
+                       VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+                       ON CONFLICT (subject_kind, call_id, model) DO UPDATE SET
+                         review_reasons=EXCLUDED.review_reasons,
+                         needs_review=EXCLUDED.needs_review,
+                         review_priority=EXCLUDED.review_priority,
+                         queued_at=COALESCE(ai_evaluation_meta.queued_at, EXCLUDED.queued_at)""",
+                    (kind, call_id, payload.get("direction_id") or 0, model,
+                     Json(payload.get("criteria") or []), payload.get("asr_mean_conf"),
+                     bool(reasons), Json(reasons), review_priority(reasons), created_at))
+        done += len(rows)
+        if len(rows) < batch:
+            return done
+
+
 def needs_review(result, direction: dict, asr_mean_conf: float | None) -> bool:
     """В ревью уходит звонок, если: плохое распознавание, есть Pending (нужна проверка
     данных/человек), низкая уверенность ИИ, или спорный критический критерий."""
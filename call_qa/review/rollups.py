@@ -0,0 +1,315 @@
+"""Дневные сводки метрик доверия для дашборда «ИИ-оценка» (api.stats).
+
+Раньше каждое открытие дашборда заново проходило весь ai_review_cache с
+человеческими оценками (calls.scores, для эпизодов чата — через снапшоты) и всю
+мету проверенных субъектов — на каждый скоуп направлений отдельно. Теперь вклад
+каждого субъекта считается один раз, когда пишется оценка или ревью, и
+складывается в две таблицы сводок:
+
+  qa_trust_verdict_rollups — ячейки матрицы «человек × ИИ»: день × направление ×
+                             критерий × модель (× тип субъекта, пара вердиктов);
+  qa_trust_review_rollups  — счётчики «чистого» эталона (подтверждено/разобрано,
+                             одобрено/исправлено, тревоги): день × направление × модель.
+
+Сводки поддерживаются дельтами. Последний посчитанный вклад субъекта лежит в
+qa_trust_facts; при пересчёте из сводок вычитается старый вклад и прибавляется
+новый, поэтому переоценка (в «сыром» эталоне участвует только последняя
+карточка субъекта) или новое исправление не задваивают счёт. Правила разбора
+карточки — те же функции, что и у полного пересчёта (api._verdict_cells,
+api._review_contribution), так что сводка и полный пересчёт не расходятся по
+построению; сверку даёт `python -m call_qa.review.rollups check`.
+
+Человеческая оценка звонка живёт в основном приложении и может появиться после
+оценки ИИ. Поэтому, кроме записи на месте (оценка/ревью), есть досчёт «сегодня»
+(refresh_recent): субъекты, у которых за последние дни появилась карточка,
+человеческая оценка, ревью или разбор. Полная пересборка — rebuild (команда
+backfill); пока она не завершена, дашборд считает по-старому.
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+
+from .. import config
+
+_STATE_ID = 1
+_LOCK_KEY = (71624, 7)  # pg_advisory_lock: одна пересборка сводок за раз
+_VERDICT_KEY = ("day", "direction_id", "direction", "criterion", "model", "subject_kind",
+                "human_verdict", "ai_verdict")
+_REVIEW_KEY = ("day", "direction_id", "model", "subject_kind")
+
+
+# ── вклад субъекта (чистые функции) ─────────────────────────────────────────
+def verdict_cells(raw_row) -> list[list]:
+    """Вклад строки api._raw_reference_rows в qa_trust_verdict_rollups:
+    [[день, direction_id, направление, критерий, модель, тип, человек, ИИ, n], ...]."""
+    from ..api import _verdict_cells
+    kind, _call_id, model, day, direction_id, criteria, scores, direction = raw_row
+    cells = {}
+    for name, hv, ai in _verdict_cells(criteria, scores):
+        key = (str(day), int(direction_id or 0), direction or "—", name, model,
+               kind or config.SUBJECT_CALL, hv, ai)
+        cells[key] = cells.get(key, 0) + 1
+    return [[*key, n] for key, n in sorted(cells.items())]
+
+
+def review_cells(review_row, corrections) -> list[list]:
+    """Вклад строки api._reviewed_rows в qa_trust_review_rollups:
+    [[день, direction_id, модель, тип, confirmed, adjudicated, endorsed, corrected,
+      alarms, alarm_hits]]."""
+    from ..api import _REVIEW_COUNTERS, _review_contribution
+    call_id, outcome, crits, kind, model, day, direction_id = review_row
+    kind = kind or config.SUBJECT_CALL
+    counters = _review_contribution(call_id, outcome, crits, kind, corrections)
+    return [[str(day), int(direction_id or 0), model, kind,
+             *(counters[key] for key in _REVIEW_COUNTERS)]]
+
+
+def deltas(old_cells, new_cells, key_len: int) -> dict[tuple, list[int]]:
+    """Разница вкладов: {ключ сводки: [приращения счётчиков]} без нулевых строк."""
+    out: dict[tuple, list[int]] = {}
+    for sign, cells in ((-1, old_cells or []), (1, new_cells or [])):
+        for cell in cells:
+            key, values = tuple(cell[:key_len]), cell[key_len:]
+            acc = out.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                acc[i] += sign * int(value or 0)
+    return {key: values for key, values in out.items() if any(values)}
+
+
+# ── запись ──────────────────────────────────────────────────────────────────
+def _apply_deltas(cur, table: str, key_cols, value_cols, changes: dict) -> None:
+    if not changes:
+        return
+    cols = (*key_cols, *value_cols)
+    updates = ", ".join(f"{c} = {table}.{c} + EXCLUDED.{c}" for c in value_cols)
+    sql = (f"INSERT INTO {table} ({', '.join(cols)}, updated_at) "
+           f"VALUES ({', '.join(['%s'] * len(cols))}, now()) "
+           f"ON CONFLICT ({', '.join(key_cols)}) DO UPDATE SET {updates}, updated_at = now()")
+    for key, values in sorted(changes.items()):
+        cur.execute(sql, (*key, *values))
+
+
+def refresh_subjects(cur, subjects) -> int:
+    """Пересчитать вклад субъектов [(subject_kind, call_id)] и сдвинуть сводки на
+    разницу. Выполняется в транзакции вызывающего; строки фактов блокируются, так
+    что параллельные пересчёты одного субъекта выстраиваются в очередь."""
+    from ..api import _REVIEW_COUNTERS, _raw_reference_rows, _review_corrections, _reviewed_rows
+    subjects = sorted({(kind or config.SUBJECT_CALL, int(call_id)) for kind, call_id in subjects})
+    if not subjects:
+        return 0
+    kinds, ids = [k for k, _ in subjects], [i for _, i in subjects]
+    cur.execute(
+        """INSERT INTO qa_trust_facts (subject_kind, call_id)
+           SELECT * FROM unnest(%s::text[], %s::bigint[])
+           ON CONFLICT (subject_kind, call_id) DO NOTHING""", (kinds, ids))
+    cur.execute(
+        """SELECT subject_kind, call_id, verdict_cells, review_cells
+             FROM qa_trust_facts
+            WHERE (subject_kind, call_id) IN (SELECT * FROM unnest(%s::text[], %s::bigint[]))
+            ORDER BY subject_kind, call_id
+              FOR UPDATE""", (kinds, ids))
+    old = {(r[0], int(r[1])): (r[2] or [], r[3] or []) for r in cur.fetchall()}
+
+    new = {subject: ([], []) for subject in subjects}
+    for row in _raw_reference_rows(cur, subjects=subjects):
+        new[(row[0] or config.SUBJECT_CALL, int(row[1]))][0].extend(verdict_cells(row))
+    reviewed = _reviewed_rows(cur, subjects=subjects)
+    corrections = _review_corrections(cur, [r[0] for r in reviewed]) if reviewed else {}
+    for row in reviewed:
+        new[(row[3] or config.SUBJECT_CALL, int(row[0]))][1].extend(review_cells(row, corrections))
+
+    verdict_changes, review_changes = {}, {}
+    for subject in subjects:
+        old_verdict, old_review = old.get(subject, ([], []))
+        for key, values in deltas(old_verdict, new[subject][0], len(_VERDICT_KEY)).items():
+            acc = verdict_changes.setdefault(key, [0])
+            acc[0] += values[0]
+        for key, values in deltas(old_review, new[subject][1], len(_REVIEW_KEY)).items():
+            acc = review_changes.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                acc[i] += value
+    _apply_deltas(cur, "qa_trust_verdict_rollups", _VERDICT_KEY, ("n",),
+                  {k: v for k, v in verdict_changes.items() if any(v)})
+    _apply_deltas(cur, "qa_trust_review_rollups", _REVIEW_KEY, _REVIEW_COUNTERS,
+                  {k: v for k, v in review_changes.items() if any(v)})
+
+    from psycopg2.extras import Json
+    for subject in subjects:
+        cur.execute(
+            """UPDATE qa_trust_facts SET verdict_cells=%s, review_cells=%s, updated_at=now()
+                WHERE subject_kind=%s AND call_id=%s""",
+            (Json(new[subject][0]), Json(new[subject][1]), *subject))
+    return len(subjects)
+
+
+def refresh_subject_safe(subject_kind, call_id) -> None:
+    """Пересчёт одного субъекта после записи оценки/ревью. Best-effort: сбой сводки
+    не должен ронять оценку — расхождение закроет refresh_recent или rebuild."""
+    conn = None
+    try:
+        conn = config.connect_rw()
+        with conn, conn.cursor() as cur:
+            refresh_subjects(cur, [(subject_kind, call_id)])
+    except Exception:
+        logging.exception("ai-qa: не удалось обновить сводки доверия (%s %s)",
+                          subject_kind, call_id)
+    finally:
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+def _recent_subjects(cur, days: int) -> list[tuple]:
+    cur.execute(
+        """SELECT subject_kind, call_id FROM ai_review_cache
+            WHERE created_at > now() - make_interval(days => %s)
+           UNION
+           SELECT subject_kind, call_id FROM ai_evaluation_meta
+            WHERE reviewed_at > now() - make_interval(days => %s)
+           UNION
+           SELECT rc.subject_kind, rc.call_id
+             FROM calls c JOIN ai_review_cache rc
+               ON rc.subject_kind = 'call' AND rc.call_id = c.id
+            WHERE c.created_at > now() - make_interval(days => %s)
+           UNION
+           SELECT 'wz_episode', e.id
+             FROM calls hc
+             JOIN c2d_chat_snapshots s ON s.id = hc.c2d_snapshot_id AND s.source = 'wazzup'
+             JOIN wazzup_episodes e ON e.channel_id = s.wz_channel_id
+                                   AND e.chat_id = s.wz_chat_id
+                                   AND e.started_at = s.episode_start
+            WHERE hc.created_at > now() - make_interval(days => %s)
+           UNION
+           SELECT subject_kind, call_id FROM qa_adjudication_cases
+            WHERE created_at > now() - make_interval(days => %s)""",
+        (days,) * 5)
+    return [(r[0], int(r[1])) for r in cur.fetchall()]
+
+
+def refresh_recent(conn, days: int = 2, batch: int = 200) -> int:
+    """Досчёт «сегодня»: субъекты, затронутые за последние days дней (новая карточка,
+    человеческая оценка звонка или чата, ревью, разбор). Идемпотентно."""
+    with conn, conn.cursor() as cur:
+        subjects = _recent_subjects(cur, max(1, int(days)))
+    for start in range(0, len(subjects), batch):
+        with conn, conn.cursor() as cur:
+            refresh_subjects(cur, subjects[start:start + batch])
+    return len(subjects)
+
+
+def rebuild(conn, batch: int = 500) -> int:
+    """Полная пересборка (backfill): сводки и факты с нуля по всем субъектам.
+    Пока идёт, дашборд считает полным пересчётом (состояние «не собрано»)."""
+    with conn, conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_lock(%s,%s)", _LOCK_KEY)
+        if not cur.fetchone()[0]:
+            raise RuntimeError("пересборка сводок доверия уже идёт")
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM qa_trust_rollup_state WHERE id = %s", (_STATE_ID,))
+            cur.execute("TRUNCATE qa_trust_facts, qa_trust_verdict_rollups, qa_trust_review_rollups")
+        done, after = 0, ("", -1)
+        while True:
+            with conn, conn.cursor() as cur:
+                cur.execute(
+                    """SELECT subject_kind, call_id FROM (
+                           SELECT subject_kind, call_id FROM ai_review_cache
+                           UNION
+                           SELECT subject_kind, call_id FROM ai_evaluation_meta
+                            WHERE review_outcome IS NOT NULL) s
+                        WHERE (subject_kind, call_id) > (%s, %s)
+                        ORDER BY subject_kind, call_id LIMIT %s""",
+                    (*after, int(batch)))
+                subjects = [(r[0], int(r[1])) for r in cur.fetchall()]
+                done += refresh_subjects(cur, subjects)
+            if len(subjects) < batch:
+                break
+            after = subjects[-1]
+        with conn, conn.cursor() as cur:
+            cur.execute(
+                """INSERT INTO qa_trust_rollup_state (id, built_at, subjects)
+                   VALUES (%s, now(), %s)
+                   ON CONFLICT (id) DO UPDATE SET built_at = now(), subjects = EXCLUDED.subjects""",
+                (_STATE_ID, done))
+        return done
+    finally:
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s,%s)", _LOCK_KEY)
+
+
+# ── чтение ──────────────────────────────────────────────────────────────────
+def dashboard(cur, *, scope_family=None, model=None):
+    """(метрики «сырого» эталона, метрики «чистого» эталона) из сводок — в форме
+    api._verdict_metrics / api._reviewed_metrics. None — сводки ещё не собраны.
+    Скоуп направлений сужает «сырой» эталон; «чистый» — общесистемный, как раньше."""
+    from ..api import _REVIEW_COUNTERS, _reviewed_from_counters, _verdict_metrics_from_cells
+    cur.execute("SELECT built_at FROM qa_trust_rollup_state WHERE id = %s", (_STATE_ID,))
+    if not cur.fetchone():
+        return None
+    scope_sql, params = "", ()
+    if scope_family is not None:
+        scope_sql, params = " WHERE direction_id = ANY(%s)", (scope_family or [-1],)
+    cur.execute(
+        """SELECT direction, criterion, human_verdict, ai_verdict, SUM(n)
+             FROM qa_trust_verdict_rollups""" + scope_sql + """
+            GROUP BY direction, criterion, human_verdict, ai_verdict
+           HAVING SUM(n) > 0""", params)
+    verdict = _verdict_metrics_from_cells(
+        (r[0], r[1], r[2], r[3], int(r[4])) for r in cur.fetchall())
+    cur.execute(
+        "SELECT " + ", ".join(f"COALESCE(SUM({c}),0)" for c in _REVIEW_COUNTERS)
+        + " FROM qa_trust_review_rollups WHERE model = %s",
+        (model or config.CLAUDE_MODEL,))
+    row = cur.fetchone() or (0,) * len(_REVIEW_COUNTERS)
+    reviewed = _reviewed_from_counters(dict(zip(_REVIEW_COUNTERS, (int(v or 0) for v in row))))
+    return verdict, reviewed
+
+
+def parity(conn, model=None) -> dict:
+    """Сверка сводок с полным пересчётом (общесистемный скоуп): {} — совпадают,
+    иначе {метрика: (полный пересчёт, сводки)}."""
+    from ..api import _raw_reference_rows, _reviewed_metrics, _verdict_metrics
+    with conn, conn.cursor() as cur:
+        rolled = dashboard(cur, model=model)
+        if rolled is None:
+            return {"state": ("собрано", "не собрано")}
+        full_verdict = _verdict_metrics(row[5:8] for row in _raw_reference_rows(cur))
+        full_reviewed = _reviewed_metrics(cur)
+    diff = {}
+    for key in ("total", "agreement", "alarm_precision", "recall", "correct_reliability", "matrix"):
+        if full_verdict[key] != rolled[0][key]:
+            diff[key] = (full_verdict[key], rolled[0][key])
+    by_full = sorted(full_verdict["by_criterion"], key=lambda r: (r["direction"], r["name"]))
+    by_rolled = sorted(rolled[0]["by_criterion"], key=lambda r: (r["direction"], r["name"]))
+    if by_full != by_rolled:
+        diff["by_criterion"] = (len(by_full), len(by_rolled))
+    if full_reviewed is not None and full_reviewed != rolled[1]:
+        diff["reviewed"] = (full_reviewed, rolled[1])
+    return diff
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сводки метрик доверия ИИ-оценки")
+    parser.add_argument("command", choices=("backfill", "recent", "check"))
+    parser.add_argument("--days", type=int, default=2)
+    args = parser.parse_args(argv)
+    conn = config.connect_rw(pooled=False)
+    try:
+        if args.command == "backfill":
+            print(f"Пересобрано субъектов: {rebuild(conn)}")
+        elif args.command == "recent":
+            print(f"Досчитано субъектов: {refresh_recent(conn, days=args.days)}")
+        else:
+            diff = parity(conn)
+            print("Сводки совпадают с полным пересчётом" if not diff else diff)
+            return 1 if diff else 0
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
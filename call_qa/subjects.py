@@ -103,7 +103,6 @@ def _load_call(call_id: int) -> dict:
     conn = config.connect_ro()
     try:
         cur = conn.cursor()
-        cur.execute("SET client_encoding TO 'UTF8'")
         cur.execute(
             """SELECT c.id, c.direction_id, d.name, u.name,
                       TO_CHAR(c.created_at,'DD.MM.YYYY, HH24:MI'), c.score, c.audio_path
@@ -130,7 +129,6 @@ def _load_wz_episode(episode_id: int) -> dict:
     conn = config.connect_ro()
     try:
         cur = conn.cursor()
-        cur.execute("SET client_encoding TO 'UTF8'")
         cur.execute(
             """SELECT e.id, e.channel_id, e.chat_id, e.chat_type, e.contact_name,
                       e.contact_phone, e.started_at, e.ended_at, e.messages_count,
@@ -241,7 +239,6 @@ def fetch_episode_messages(subject: dict) -> list[dict]:
     conn = config.connect_ro()
     try:
         cur = conn.cursor()
-        cur.execute("SET client_encoding TO 'UTF8'")
         cur.execute(
             """SELECT m.message_id, m.dt, m.is_echo, m.type, m.text, m.content_uri,
                       m.author_name, m.author_id, COALESCE(map.is_bot, FALSE),
@@ -50,6 +50,8 @@ from datetime import datetime, timedelta, timezone
 
 import requests
 
+import http_clients
+
 log = logging.getLogger(__name__)
 
 DEFAULT_API_URL = "https://api.chatapp.online"
@@ -57,6 +59,9 @@ HTTP_TIMEOUT = 60
 PAGE_LIMIT = 100          # потолок ChatApp и для чатов, и для сообщений
 MAX_PAGES = 200           # предохранитель от бесконечного листания
 RETRY_STATUSES = (429, 500, 502, 503, 504)
+# 50 req/s на IP — общий для всех нитей темп держит http_clients; на 429 он же
+# ставит хост на паузу для всех нитей, а повторяет запрос `_get`.
+RATE_PER_SECOND = 50
 # Запас, с которым считаем accessToken протухшим (часы/минуты у нас и у них плывут).
 TOKEN_SKEW_SECONDS = 120
 
@@ -101,7 +106,8 @@ class ChatAppClient:
         self.app_id = app_id
         self.api_url = api_url.rstrip('/')
         self.token_store = token_store
-        self.session = session or requests.Session()
+        self.session = session or http_clients.session(
+            'chatapp', rate_per_second=RATE_PER_SECOND, retries=0)
         self._tokens = None
 
     @classmethod
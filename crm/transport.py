@@ -14,8 +14,7 @@ delivery_status='failed' и отправляется повторно.
 import logging
 import os
 
-import requests
-
+import http_clients
 import log_secrets
 
 API_ROOT = 'https://api.telegram.org'
@@ -23,6 +22,11 @@ DEFAULT_TIMEOUT = 15
 # Файл из переписки может быть крупным; на скачивание даём больше времени.
 FILE_TIMEOUT = 60
 
+# Соединение с api.telegram.org держим из общего пула интеграций: карточка
+# обращения уходит несколькими запросами подряд (текст, вложения), и каждый
+# платил новым TLS-рукопожатием. На 429 пул ставит Telegram на паузу целиком.
+_session = http_clients.session('telegram')
+
 
 def _error_text(error):
     """Текст ошибки без токена бота.
@@ -46,9 +50,9 @@ def _call(method, *, json_payload=None, params=None, timeout=DEFAULT_TIMEOUT):
     try:
         url = '%s/bot%s/%s' % (API_ROOT, token, method)
         if json_payload is not None:
-            response = requests.post(url, json=json_payload, timeout=timeout)
+            response = _session.post(url, json=json_payload, timeout=timeout)
         else:
-            response = requests.get(url, params=params or {}, timeout=timeout)
+            response = _session.get(url, params=params or {}, timeout=timeout)
         data = response.json()
         if not data.get('ok'):
             return None, data.get('description') or ('HTTP %s' % response.status_code)
@@ -113,7 +117,7 @@ def send_attachment(chat_id, *, file_name, stream, mimetype=None,
         if parse_mode:
             data['parse_mode'] = parse_mode
     try:
-        response = requests.post(
+        response = _session.post(
             '%s/bot%s/%s' % (API_ROOT, token, method),
             data=data,
             files={field: (file_name, stream, mimetype or 'application/octet-stream')},
@@ -142,7 +146,7 @@ def fetch_file(file_id):
     if not file_path:
         return None, 'Telegram не отдал путь к файлу'
     try:
-        response = requests.get(
+        response = _session.get(
             '%s/file/bot%s/%s' % (API_ROOT, _token(), file_path),
             timeout=FILE_TIMEOUT,
         )
@@ -33,6 +33,9 @@ from collections import defaultdict
 import pandas as pd
 from typing import List, Dict, Any, Tuple, Optional
 
+import pg_pool_metrics
+import xlsx_stream
+
 logging.basicConfig(level=logging.INFO)
 
 os.environ['TZ'] = 'Asia/Almaty'
@@ -69,6 +72,11 @@ POOL_WAIT_WARN_SECONDS = _env_float('POSTGRES_POOL_WAIT_WARN_SECONDS', 2, minimu
 POOL = None
 POOL_LOCK = threading.Lock()
 POOL_SEMAPHORE = None
+# Квоты соединений по потребителям (маршрут, джоба, пул нитей) — формат и
+# смысл в pg_pool_metrics.py. Пусто = квот нет, только учёт.
+pg_pool_metrics.configure_budgets(
+    pg_pool_metrics.parse_budgets(os.getenv('POSTGRES_POOL_CONSUMER_BUDGETS', ''))
+)
 STATUS_IMPORT_INSERT_PAGE_SIZE = max(200, int(os.getenv('STATUS_IMPORT_INSERT_PAGE_SIZE', '2000')))
 # Retention horizon for raw operator_status_events. They are only a rebuild source for
 # operator_status_segments (the durable report data, which is never purged). The daily purge
@@ -81,10 +89,106 @@ SHIFT_AUCTION_TEST_EVENT_NOTIFY_CHANNEL = 'shift_auction_test_events'
 BELL_EVENTS_NOTIFY_CHANNEL = 'bell_events'
 SHIFT_AUCTION_SNAPSHOT_CACHE_TTL_SECONDS = _env_float('SHIFT_AUCTION_SNAPSHOT_CACHE_TTL_SECONDS', 1.5, minimum=0)
 SHIFT_AUCTION_PARTICIPANT_CACHE_TTL_SECONDS = _env_float('SHIFT_AUCTION_PARTICIPANT_CACHE_TTL_SECONDS', 2, minimum=0)
-SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE = {"key": None, "expires_at": 0.0, "value": None}
+# Общий снимок аукциона версионируется id последнего события (shift_auction_test_events
+# растёт монотонно, и каждая запись — взятие, отказ, правка админа — пишет событие).
+# Версией служит не MAX(id), а «устоявшийся» id: id событий берутся из nextval до
+# фиксации, и взятия разных операторов фиксируются параллельно — 104 может стать
+# видимым раньше 103. Клиент с версией 104 попросил бы since=104 и 103 не увидел бы
+# никогда. Каждое событие помнит settle_xmax — txid_snapshot_xmax сразу после выдачи
+# его id (см. _insert_shift_auction_test_event); когда xmin снимка читателя дорос до
+# него, все транзакции, державшие меньшие id, завершены. Версия — наибольший такой id.
+SHIFT_AUCTION_SETTLED_VERSION_SQL = """
+    SELECT COALESCE((
+        SELECT e.id
+        FROM shift_auction_test_events e
+        WHERE e.settle_xmax IS NULL
+           OR e.settle_xmax <= txid_snapshot_xmin(txid_current_snapshot())
+        ORDER BY e.id DESC
+        LIMIT 1
+    ), 0)
+"""
+# Запись кэша на (вид монитора, неделя): {"version", "built_at", "refreshed_at", "value"}.
+SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE = {}
 SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE_LOCK = threading.Lock()
+# Сколько живёт снимок, который доводят до новой версии патчем, прежде чем его
+# соберут целиком: патч видит только то, что записано событиями, а переименование
+# оператора или правку статуса подхватит лишь полная сборка.
+SHIFT_AUCTION_SNAPSHOT_PATCH_MAX_AGE_SECONDS = _env_float('SHIFT_AUCTION_SNAPSHOT_PATCH_MAX_AGE_SECONDS', 30, minimum=0)
+SHIFT_AUCTION_SNAPSHOT_PATCH_MAX_EVENTS = 500
+# События, которые меняют только отдельные лоты и нагрузку их операторов. Всё
+# остальное (настройки, пересев, пауза, публикация) — повод собрать снимок заново.
+SHIFT_AUCTION_LOT_PATCH_EVENT_TYPES = frozenset({
+    "lot_claimed",
+    "lot_released",
+    "lot_post_auction_claimed",
+    "lot_post_auction_cancelled",
+    "lot_admin_claimed",
+    "lot_admin_unclaimed",
+    "lot_added",
+    "shift_self_scheduled",
+    "self_scheduled_shift_removed",
+    "day_off_selected",
+    "day_off_removed",
+})
 SHIFT_AUCTION_PARTICIPANT_CACHE = {"expires_at": 0.0, "ids": frozenset()}
 SHIFT_AUCTION_PARTICIPANT_CACHE_LOCK = threading.Lock()
+# Портрет пользователя для проверок доступа: свой отдел и возглавляемые отделы.
+# Кэш процесса короткий и сбрасывается на записях, которые его меняют
+# (update_user, assign_user_department, set_department_head, update_department);
+# TTL страхует от прочих путей записи — массовых импортов и миграций.
+USER_PRINCIPAL_SCOPE_CACHE_TTL_SECONDS = _env_float('USER_PRINCIPAL_SCOPE_CACHE_TTL_SECONDS', 30, minimum=0)
+USER_PRINCIPAL_SCOPE_CACHE = {}  # user_id -> (expires_at, scope)
+USER_PRINCIPAL_SCOPE_CACHE_LOCK = threading.Lock()
+# Фрагмент SELECT к users u: отдел и массив возглавляемых активных отделов в
+# порядке headed_department_id_for_user — первый элемент и есть «главный».
+USER_PRINCIPAL_SCOPE_COLUMNS_SQL = (
+    "u.department_id,"
+    " ARRAY(SELECT hd.id FROM departments hd"
+    " WHERE hd.head_user_id = u.id AND COALESCE(hd.is_active, TRUE) = TRUE"
+    " ORDER BY hd.name, hd.id)"
+)
+# Свёртка «оператор × месяц» (operator_month_rollups) для «Учёта часов»: была ли
+# у оператора в месяце работа, членство в группе и какая ставка действовала.
+# Ставка месяца по свёртке, если строка есть (алиас r), иначе — прежний перенос
+# по work_hours. Один параметр %s — месяц, как у заменённого подзапроса.
+OPERATOR_MONTH_RATE_SQL = """
+    CASE WHEN r.operator_id IS NOT NULL THEN COALESCE(r.effective_rate, u.rate)
+    ELSE COALESCE(
+        (SELECT wr.rate FROM work_hours wr
+         WHERE wr.operator_id = u.id AND wr.rate IS NOT NULL AND wr.month <= %s
+         ORDER BY wr.month DESC LIMIT 1),
+        u.rate
+    ) END
+"""
+# Пересчёт строк свёртки с нуля — общий для инкрементального обновления и
+# проверки согласованности: «правильно» определено ровно в одном месте.
+# Параметры: months (text[] или NULL = все собранные), from_month, operator_ids.
+OPERATOR_MONTH_ROLLUP_RECOMPUTE_SQL = """
+    SELECT u.id AS operator_id, m.month,
+        EXISTS (
+            SELECT 1 FROM daily_hours dh
+            WHERE dh.operator_id = u.id AND dh.day >= m.start_day AND dh.day <= m.end_day
+        ) AS has_daily_hours,
+        EXISTS (
+            SELECT 1 FROM group_operator_memberships gom
+            WHERE gom.operator_id = u.id AND gom.start_date <= m.end_day
+              AND (gom.end_date IS NULL OR gom.end_date >= m.start_day)
+        ) AS has_membership,
+        (SELECT wr.rate FROM work_hours wr
+         WHERE wr.operator_id = u.id AND wr.rate IS NOT NULL AND wr.month <= m.month
+         ORDER BY wr.month DESC LIMIT 1) AS effective_rate
+    FROM operator_month_rollup_months m
+    CROSS JOIN users u
+    WHERE (%(months)s::text[] IS NULL OR m.month = ANY(%(months)s::text[]))
+      AND (%(from_month)s::text IS NULL OR m.month >= %(from_month)s::text)
+      AND (%(operator_ids)s::int[] IS NULL OR u.id = ANY(%(operator_ids)s::int[]))
+"""
+# Колонки export_jobs в порядке Database._serialize_export_job.
+EXPORT_JOB_COLUMNS_SQL = """
+    id, kind, requester_id, params, status, progress_done, progress_total,
+    attempts, error, file_name, result_bucket, result_blob_path, result_size,
+    created_at, started_at, finished_at
+"""
 SHIFT_AUCTION_DIRECTION_NAME = 'Основа'
 SHIFT_AUCTION_DEPARTMENT_CODE = 'szov'
 SHIFT_AUCTION_ACTIVE_OPERATOR_STATUS = 'working'
@@ -209,14 +313,121 @@ def normalize_sip_identifier(value, field="SIP-номер"):
 
 def _invalidate_shift_auction_runtime_caches(include_participants=False):
     with SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE_LOCK:
-        SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE["key"] = None
-        SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE["expires_at"] = 0.0
-        SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE["value"] = None
+        SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE.clear()
     if include_participants:
         with SHIFT_AUCTION_PARTICIPANT_CACHE_LOCK:
             SHIFT_AUCTION_PARTICIPANT_CACHE["expires_at"] = 0.0
             SHIFT_AUCTION_PARTICIPANT_CACHE["ids"] = frozenset()
 
+
+def _shift_auction_event_int(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _shift_auction_events_patch_scope(events):
+    """Что затронули события аукциона [(event_type, payload), ...].
+
+    Возвращает {"lot_ids", "source_pairs", "operator_ids", "event_types"} или None,
+    если среди событий есть структурное: такой диапазон патчем не покрыть.
+    Пары (план, смена-источник) нужны потому, что доборы одной смены живут на
+    нескольких лотах, а claim_segments каждого из них собираются по всей смене.
+    """
+    scope = {"lot_ids": set(), "source_pairs": set(), "operator_ids": set(), "event_types": set()}
+    for event_type, payload in events or []:
+        if event_type not in SHIFT_AUCTION_LOT_PATCH_EVENT_TYPES:
+            return None
+        scope["event_types"].add(event_type)
+        payload = payload if isinstance(payload, dict) else {}
+        lot = payload.get("lot") if isinstance(payload.get("lot"), dict) else {}
+        for lot_id in (lot.get("id"), payload.get("lot_id")):
+            lot_id = _shift_auction_event_int(lot_id)
+            if lot_id is not None:
+                scope["lot_ids"].add(lot_id)
+        for plan_id, shift_id in (
+            (lot.get("source_schedule_plan_id"), lot.get("source_schedule_shift_id")),
+            (payload.get("plan_id") or payload.get("source_schedule_plan_id"), payload.get("source_schedule_shift_id")),
+        ):
+            plan_id, shift_id = _shift_auction_event_int(plan_id), _shift_auction_event_int(shift_id)
+            if plan_id is not None and shift_id is not None:
+                scope["source_pairs"].add((plan_id, shift_id))
+        segments = lot.get("claim_segments") if isinstance(lot.get("claim_segments"), list) else []
+        for operator_id in (
+            payload.get("operator_id"),
+            lot.get("claimed_by"),
+            *(segment.get("claimed_by") for segment in segments if isinstance(segment, dict)),
+        ):
+            operator_id = _shift_auction_event_int(operator_id)
+            if operator_id is not None:
+                scope["operator_ids"].add(operator_id)
+    return scope
+
+
+def _shift_auction_lot_operator_ids(lot):
+    """Операторы, чью нагрузку меняет лот: владелец и участники доборов."""
+    ids = set()
+    owner = _shift_auction_event_int(lot.get("claimed_by"))
+    if owner is not None:
+        ids.add(owner)
+    for segment in lot.get("claim_segments") or []:
+        if isinstance(segment, dict):
+            segment_owner = _shift_auction_event_int(segment.get("claimed_by"))
+            if segment_owner is not None:
+                ids.add(segment_owner)
+    return ids
+
+
+def _shift_auction_scope_lot_ids(lots, scope):
+    """id лотов из lots, которые задевает scope — прямо или через смену-источник."""
+    pairs = scope["source_pairs"]
+    return {
+        int(lot["id"])
+        for lot in lots or []
+        if lot.get("id") is not None and (
+            int(lot["id"]) in scope["lot_ids"]
+            or (lot.get("source_schedule_plan_id"), lot.get("source_schedule_shift_id")) in pairs
+        )
+    }
+
+
+def _merge_shift_auction_lots(lots, fresh_lots, changed_ids):
+    """Заменить в lots лоты changed_ids свежими строками; порядок — как у полной сборки."""
+    merged = [lot for lot in lots or [] if int(lot["id"]) not in changed_ids]
+    merged.extend(fresh_lots or [])
+    merged.sort(key=lambda lot: (lot.get("shift_date") or "", lot.get("start_time") or "", int(lot["id"])))
+    return merged
+
+
+def _user_principal_scope_from_row(department_id, headed_ids):
+    return {
+        "department_id": int(department_id) if department_id is not None else None,
+        "headed_department_ids": tuple(int(x) for x in (headed_ids or []) if x is not None),
+    }
+
+
+def _store_user_principal_scope(user_id, scope):
+    if not user_id or scope is None or USER_PRINCIPAL_SCOPE_CACHE_TTL_SECONDS <= 0:
+        return
+    with USER_PRINCIPAL_SCOPE_CACHE_LOCK:
+        USER_PRINCIPAL_SCOPE_CACHE[int(user_id)] = (
+            time.monotonic() + USER_PRINCIPAL_SCOPE_CACHE_TTL_SECONDS, scope
+        )
+
+
+def invalidate_user_principal_scope(user_id=None):
+    """Сбросить кэш портрета одного пользователя, а без user_id — всех."""
+    with USER_PRINCIPAL_SCOPE_CACHE_LOCK:
+        if user_id is None:
+            USER_PRINCIPAL_SCOPE_CACHE.clear()
+        else:
+            try:
+                USER_PRINCIPAL_SCOPE_CACHE.pop(int(user_id), None)
+            except (TypeError, ValueError):
+                pass
+
+
 ROLE_ALIASES = {
     'supervisor': 'sv',
     'superadmin': 'super_admin',
@@ -1036,7 +1247,9 @@ def get_pool():
                     'user': os.getenv('POSTGRES_USER'),
                     'password': os.getenv('POSTGRES_PASSWORD'),
                     'host': os.getenv('POSTGRES_HOST'),
-                    'port': os.getenv('POSTGRES_PORT', 5432)
+                    'port': os.getenv('POSTGRES_PORT', 5432),
+                    # Курсор по умолчанию считает запросы выдачи для учёта пула.
+                    'cursor_factory': pg_pool_metrics.CountingCursor,
                 }
                 POOL = ThreadedConnectionPool(MIN_CONN, MAX_CONN, **conn_params)
                 POOL_SEMAPHORE = threading.BoundedSemaphore(MAX_CONN)
@@ -1095,32 +1308,37 @@ class Database:
     def _get_connection(self):
         pool = get_pool()
         semaphore = POOL_SEMAPHORE
+        consumer = pg_pool_metrics.current_consumer()
         acquire_started_at = time.perf_counter()
-        acquired = True
-        if semaphore is not None:
-            acquired = semaphore.acquire(timeout=POOL_ACQUIRE_TIMEOUT_SECONDS)
-        if not acquired:
-            raise TimeoutError("POSTGRES_POOL_ACQUIRE_TIMEOUT")
-
-        waited_seconds = time.perf_counter() - acquire_started_at
-        if POOL_WAIT_WARN_SECONDS and waited_seconds >= POOL_WAIT_WARN_SECONDS:
-            logging.warning(
-                "Waited %.2fs for PostgreSQL pool slot (max=%s)",
-                waited_seconds,
-                MAX_CONN
-            )
-
-        conn = None
-        try:
-            conn = pool.getconn()
-            yield conn
-        except Exception:
-            raise
-        finally:
-            if conn is not None:
-                pool.putconn(conn)
+        # Квота и слот пула делят один срок: ожидание квоты вычитается из ожидания слота.
+        acquire_deadline = acquire_started_at + POOL_ACQUIRE_TIMEOUT_SECONDS
+        with pg_pool_metrics.acquire_budget(consumer, POOL_ACQUIRE_TIMEOUT_SECONDS):
+            acquired = True
             if semaphore is not None:
-                semaphore.release()
+                acquired = semaphore.acquire(timeout=max(0.0, acquire_deadline - time.perf_counter()))
+            if not acquired:
+                pg_pool_metrics.record_timeout(consumer)
+                raise TimeoutError("POSTGRES_POOL_ACQUIRE_TIMEOUT")
+
+            waited_seconds = time.perf_counter() - acquire_started_at
+            if POOL_WAIT_WARN_SECONDS and waited_seconds >= POOL_WAIT_WARN_SECONDS:
+                logging.warning(
+                    "Waited %.2fs for PostgreSQL pool slot (max=%s, consumer=%s)",
+                    waited_seconds,
+                    MAX_CONN,
+                    consumer
+                )
+
+            conn = None
+            try:
+                with pg_pool_metrics.track_checkout(consumer, waited_seconds):
+                    conn = pool.getconn()
+                    yield conn
+            finally:
+                if conn is not None:
+                    pool.putconn(conn)
+                if semaphore is not None:
+                    semaphore.release()
 
     @contextmanager
     def _get_cursor(self):
@@ -1682,6 +1900,32 @@ class Database:
             cursor.execute(
                 "ALTER TABLE group_month_snapshots ADD COLUMN IF NOT EXISTS frozen_at TIMESTAMP"
             )
+            # Свёртка «оператор × месяц» для «Учёта часов»: видимость оператора в
+            # месяце (daily_hours / членство) и ставка по переносу. Раньше это
+            # считалось EXISTS-сканами и коррелированным подзапросом на каждой
+            # загрузке страницы. Месяц собирается целиком при первом чтении
+            # (operator_month_rollup_months), дальше строки обновляются на записях
+            # — см. _refresh_operator_month_rollups_tx.
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS operator_month_rollup_months (
+                    month VARCHAR(7) PRIMARY KEY,
+                    start_day DATE NOT NULL,
+                    end_day DATE NOT NULL,
+                    built_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS operator_month_rollups (
+                    operator_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                    month VARCHAR(7) NOT NULL
+                        REFERENCES operator_month_rollup_months(month) ON DELETE CASCADE,
+                    has_daily_hours BOOLEAN NOT NULL DEFAULT FALSE,
+                    has_membership BOOLEAN NOT NULL DEFAULT FALSE,
+                    effective_rate DECIMAL(3,2),
+                    refreshed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (month, operator_id)
+                );
+            """)
             # Журнал смены модели расчёта группы. Каждая запись = одно изменение
             # (old -> new), позволяет откатить случайную смену модели без потери
             # данных: сырьё (daily_hours/метрики чатов) и замороженные снимки
@@ -3938,6 +4182,25 @@ class Database:
                 VALUES (1)
                 ON CONFLICT (id) DO NOTHING;
             """)
+            # Хэш настроек, под которыми последний раз пересчитан прогноз прошедших дней:
+            # пока он совпадает, загрузка пересчитывает только затронутые недели.
+            cursor.execute("""
+                ALTER TABLE resource_settings
+                ADD COLUMN IF NOT EXISTS historical_forecast_settings_hash VARCHAR(64);
+            """)
+            # Кэш посуточных профилей прогноза и всплеска нагрузки. Запись годна, пока
+            # совпадают хэш настроек и history_watermark (updated_at исходных загрузок).
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS resource_forecast_cache (
+                    kind VARCHAR(20) NOT NULL,
+                    cache_date DATE NOT NULL,
+                    settings_hash VARCHAR(64) NOT NULL,
+                    history_watermark TEXT NOT NULL DEFAULT '',
+                    payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+                    computed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (kind, cache_date, settings_hash)
+                );
+            """)
             # Настройки распределения звонков на оценку («Деление звонков»): фильтр длительности
             # + флаг автораспределения. Singleton + аудит (кто/когда), история изменений отдельно.
             cursor.execute("""
@@ -4143,6 +4406,47 @@ class Database:
                     CONSTRAINT szov_wallboard_snapshot_singleton CHECK (id = 1)
                 );
             """)
+            # Общий кэш процессов: снимки табло и подписанные ссылки аватаров, которые иначе
+            # каждый процесс waitress держал бы у себя и получал заново. UNLOGGED — мимо WAL:
+            # после падения базы таблица пустеет, и это нормально, всё в ней пересчитывается.
+            cursor.execute("""
+                CREATE UNLOGGED TABLE IF NOT EXISTS shared_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    value JSONB NOT NULL,
+                    expires_at TIMESTAMPTZ NOT NULL
+                );
+            """)
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_shared_cache_expires_at ON shared_cache (expires_at)"
+            )
+            # Журнал прогонов джоб планировщика (scheduler_pools): одна строка на прогон любой
+            # джобы. До него прогоны писали только group_late, amoCRM и конкурс регистраций — каждый
+            # в свою таблицу и своим форматом, и подползание джобы к своему интервалу было не видно.
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS scheduler_job_runs (
+                    id BIGSERIAL PRIMARY KEY,
+                    job_id TEXT NOT NULL,
+                    pool TEXT,
+                    started_at TIMESTAMPTZ NOT NULL,
+                    finished_at TIMESTAMPTZ NOT NULL,
+                    duration_ms INTEGER NOT NULL,
+                    ok BOOLEAN NOT NULL,
+                    rows_processed INTEGER,
+                    external_calls INTEGER NOT NULL DEFAULT 0,
+                    queue_wait_ms INTEGER NOT NULL DEFAULT 0,
+                    budget_wait_ms INTEGER NOT NULL DEFAULT 0,
+                    interval_seconds INTEGER,
+                    error TEXT
+                );
+            """)
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_scheduler_job_runs_started "
+                "ON scheduler_job_runs (started_at DESC)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_scheduler_job_runs_job_started "
+                "ON scheduler_job_runs (job_id, started_at DESC)"
+            )
             # Выходы на перерыв мимо графика (задача #114). Пишем ТОЛЬКО нарушения: перерыв,
             # совпавший с графиком, — это норма, и хранить её незачем.
             #   kind: off_schedule — перерыв есть в графике, но в другое время;
@@ -4501,6 +4805,9 @@ class Database:
                     created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
                 );
             """)
+            # Горизонт устоявшейся версии снимка (SHIFT_AUCTION_SETTLED_VERSION_SQL);
+            # у событий до этой колонки NULL — они давно устоялись.
+            cursor.execute("ALTER TABLE shift_auction_test_events ADD COLUMN IF NOT EXISTS settle_xmax BIGINT NULL;")
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS shift_auction_published_periods (
                     plan_id INTEGER PRIMARY KEY REFERENCES resource_saved_schedule_plans(id) ON DELETE CASCADE,
@@ -5546,6 +5853,8 @@ class Database:
             """)
             self._init_group_late_bot_schema_tx(cursor)
             self._init_amo_leads_schema_tx(cursor)
+            self._init_export_jobs_schema_tx(cursor)
+            self._init_oktell_billing_days_schema_tx(cursor)
             self._init_chat_hourly_schema_tx(cursor)
             self._init_reg_contest_schema_tx(cursor)
             self._init_front_office_calls_schema_tx(cursor)
@@ -5625,17 +5934,29 @@ class Database:
         Триггеры, а не вызовы в коде записи: точек записи много и часть из них
         не проходит через роуты вовсе (ночной materialize_due_regulation_tasks
         создаёт задачи регламентов, назначения опросов пишутся пачками) —
-        триггер не забудешь позвать. Payload несёт только адресатов
-        ('{"u":[id,...]}' либо '{"b":1}' для широковещательного), данные никто
-        не передаёт: получив тычок, клиент сам перечитывает /api/notifications,
-        поэтому потерянный тычок — это максимум задержка до обновления по
-        фокусу, а не потерянное уведомление.
+        триггер не забудешь позвать. Payload несёт только адресатов и имя
+        источника ('{"u":[id,...],"s":"tasks"}' либо '{"b":1,"s":"events"}' для
+        широковещательного), данные никто не передаёт: получив тычок, клиент
+        сам перечитывает /api/notifications, поэтому потерянный тычок — это
+        максимум задержка до обновления по фокусу, а не потерянное уведомление.
+        Имя источника нужно серверу: по нему слушатель сбрасывает в кеше
+        сводки только этот раздел (notifications/cache.py). Рядом "r" — id
+        изменившейся строки раздела (поста, задачи, опроса, статьи), если она
+        одна: поток в режиме дельт передаёт его клиенту вместе с пересчитанным
+        источником (notifications/realtime.py).
+
+        "i" — сквозной номер тычка из bell_event_seq, один на все процессы:
+        курсор возобновления потока дельт. Порядок номеров — порядок вызова
+        nextval, а не коммита, зато NOTIFY все слушатели получают в одном и том
+        же порядке коммитов, — поэтому курсор ищут в кольце по членству, а не
+        сравнивают числа (см. realtime.resume_seq).
 
         «Ивенты» и «4 You» широковещательные: их видимость зависит от отдела
         зрителя, и вычислять круг адресатов в триггере значило бы продублировать
         _events_viewer_scope на PL/pgSQL. Дешевле разбудить всех — каждый клиент
         перечитает свою сводку, и сервер сам отфильтрует по периметру.
         """
+        cursor.execute("CREATE SEQUENCE IF NOT EXISTS bell_event_seq")
         cursor.execute("""
             CREATE OR REPLACE FUNCTION bell_notify_change()
             RETURNS TRIGGER
@@ -5643,12 +5964,27 @@ class Database:
             AS $$
             DECLARE
                 targets INTEGER[] := ARRAY[]::INTEGER[];
+                -- Имя источника из notifications/sources.py::SOURCES.
+                bell_source TEXT := CASE
+                    WHEN TG_TABLE_NAME IN ('events', 'event_reads') THEN 'events'
+                    WHEN TG_TABLE_NAME IN ('four_you_images', 'four_you_reads') THEN 'four_you'
+                    WHEN TG_TABLE_NAME = 'lms_notifications' THEN 'lms'
+                    WHEN TG_TABLE_NAME IN ('surveys', 'survey_assignments') THEN 'surveys'
+                    WHEN TG_TABLE_NAME = 'wiki_ack_assignments' THEN 'wiki_ack'
+                    WHEN TG_TABLE_NAME = 'birthday_reads' THEN 'birthdays'
+                    WHEN TG_TABLE_NAME = 'crm_tickets' THEN 'crm'
+                    WHEN TG_TABLE_NAME IN ('tasks', 'task_assignees', 'task_action_reads') THEN 'tasks'
+                END;
+                bell_row BIGINT;
             BEGIN
                 IF TG_TABLE_NAME IN ('events', 'four_you_images') THEN
-                    PERFORM pg_notify('bell_events', '{"b":1}');
+                    PERFORM pg_notify('bell_events',
+                                      json_build_object('b', 1, 's', bell_source, 'r', NEW.id,
+                                                        'i', nextval('bell_event_seq'))::text);
                     RETURN NULL;
                 ELSIF TG_TABLE_NAME = 'lms_notifications' THEN
                     targets := ARRAY[NEW.user_id];
+                    bell_row := NEW.id;
                 ELSIF TG_TABLE_NAME = 'surveys' THEN
                     -- Уход опроса в архив убирает его из сводки у ВСЕХ, кому он
                     -- был назначен: адресатов достаём из назначений, своего
@@ -5657,6 +5993,7 @@ class Database:
                         SELECT sa.operator_id FROM survey_assignments sa
                          WHERE sa.survey_id = NEW.id
                     );
+                    bell_row := NEW.id;
                 ELSIF TG_TABLE_NAME = 'survey_assignments' THEN
                     -- В черновике теста UPDATE всегда упоминает status и
                     -- started_at. Состав колокола меняется лишь при смене
@@ -5672,6 +6009,7 @@ class Database:
                     IF TG_OP = 'UPDATE' THEN
                         targets := targets || ARRAY[OLD.operator_id];
                     END IF;
+                    bell_row := NEW.survey_id;
                 ELSIF TG_TABLE_NAME = 'wiki_ack_assignments' THEN
                     -- Прокрутка и раскрытие блоков меняют служебный прогресс,
                     -- но уведомление остаётся тем же. Будим только если
@@ -5691,6 +6029,7 @@ class Database:
                     IF TG_OP = 'UPDATE' THEN
                         targets := targets || ARRAY[OLD.user_id];
                     END IF;
+                    bell_row := NEW.article_id;
                 ELSIF TG_TABLE_NAME IN ('event_reads', 'four_you_reads') THEN
                     -- Водяной знак гасит бейдж. Адресная тычка синхронизирует
                     -- остальные вкладки того же пользователя без массовой
@@ -5705,6 +6044,7 @@ class Database:
                     targets := ARRAY[NEW.user_id];
                 ELSIF TG_TABLE_NAME = 'task_action_reads' THEN
                     targets := ARRAY[NEW.user_id];
+                    bell_row := NEW.task_id;
                 ELSIF TG_TABLE_NAME = 'crm_tickets' THEN
                     -- У обращения ровно один адресат уведомлений — его автор:
                     -- это он ждёт ответа из группы и отметки «выполнено».
@@ -5714,6 +6054,7 @@ class Database:
                     IF TG_OP = 'UPDATE' THEN
                         targets := targets || ARRAY[OLD.created_by];
                     END IF;
+                    bell_row := NEW.id;
                 ELSIF TG_TABLE_NAME = 'tasks' THEN
                     -- Исполнители и принимающий; при UPDATE — и прежние тоже:
                     -- переназначенная задача должна погаснуть у старого владельца.
@@ -5727,6 +6068,7 @@ class Database:
                         targets := targets || ARRAY[OLD.assigned_to,
                                                     COALESCE(OLD.requested_by_id, OLD.created_by)];
                     END IF;
+                    bell_row := NEW.id;
                 ELSIF TG_TABLE_NAME = 'task_assignees' THEN
                     -- Состав поменялся: будим и добавленного, и снятого. Здесь
                     -- обязательно COALESCE(NEW, OLD) — при DELETE есть только OLD,
@@ -5734,13 +6076,18 @@ class Database:
                     -- EXCEPTION-обёртка сделала бы это молча).
                     IF TG_OP = 'DELETE' THEN
                         targets := ARRAY[OLD.user_id];
+                        bell_row := OLD.task_id;
                     ELSE
                         targets := ARRAY[NEW.user_id];
+                        bell_row := NEW.task_id;
                     END IF;
                 END IF;
                 targets := ARRAY(SELECT DISTINCT t FROM unnest(targets) AS t WHERE t IS NOT NULL);
                 IF array_length(targets, 1) IS NOT NULL THEN
-                    PERFORM pg_notify('bell_events', json_build_object('u', targets)::text);
+                    PERFORM pg_notify('bell_events',
+                                      json_build_object('u', targets, 's', bell_source,
+                                                        'r', bell_row,
+                                                        'i', nextval('bell_event_seq'))::text);
                 END IF;
                 RETURN NULL;
             EXCEPTION WHEN OTHERS THEN
@@ -5839,6 +6186,314 @@ class Database:
                 EXECUTE FUNCTION bell_notify_change();
             """)
 
+    # --- Фоновые выгрузки (см. export_jobs.py) ----------------------------------------------------
+    def _init_export_jobs_schema_tx(self, cursor):
+        """Очередь фоновых выгрузок и их чекпоинты по единицам (обычно — по суткам)."""
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS export_jobs (
+                id               BIGSERIAL PRIMARY KEY,
+                kind             TEXT NOT NULL,
+                requester_id     INTEGER REFERENCES users(id) ON DELETE SET NULL,
+                params           JSONB NOT NULL DEFAULT '{}'::jsonb,
+                status           TEXT NOT NULL DEFAULT 'queued',
+                progress_done    INTEGER NOT NULL DEFAULT 0,
+                progress_total   INTEGER NOT NULL DEFAULT 0,
+                attempts         INTEGER NOT NULL DEFAULT 0,
+                worker           TEXT,
+                error            TEXT,
+                file_name        TEXT,
+                result_bucket    TEXT,
+                result_blob_path TEXT,
+                result_size      BIGINT,
+                created_at       TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                started_at       TIMESTAMPTZ,
+                heartbeat_at     TIMESTAMPTZ,
+                finished_at      TIMESTAMPTZ,
+                retry_at         TIMESTAMPTZ
+            );
+            -- Повтор после ошибки не выдаётся раньше retry_at (нарастающая пауза воркера).
+            ALTER TABLE export_jobs ADD COLUMN IF NOT EXISTS retry_at TIMESTAMPTZ;
+            -- Очередь читается только по незавершённым задачам: частичный индекс
+            -- остаётся крошечным, сколько бы готовых выгрузок ни накопилось.
+            CREATE INDEX IF NOT EXISTS idx_export_jobs_pending
+                ON export_jobs(created_at, id) WHERE status IN ('queued', 'running');
+            CREATE INDEX IF NOT EXISTS idx_export_jobs_requester
+                ON export_jobs(requester_id, created_at DESC);
+
+            -- Результат единицы задачи. Живёт, пока задача не завершилась: на повторе
+            -- посчитанные сутки берутся отсюда, а не из источника.
+            CREATE TABLE IF NOT EXISTS export_job_chunks (
+                job_id     BIGINT NOT NULL REFERENCES export_jobs(id) ON DELETE CASCADE,
+                unit       TEXT NOT NULL,
+                payload    JSONB NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (job_id, unit)
+            );
+        """)
+
+    def _serialize_export_job(self, row):
+        if not row:
+            return None
+        params = row[3]
+        if isinstance(params, str):
+            params = json.loads(params)
+
+        def _iso(value):
+            return value.isoformat() if value else None
+
+        return {
+            "id": int(row[0]),
+            "kind": row[1],
+            "requester_id": row[2],
+            "params": params or {},
+            "status": row[4],
+            "progress_done": int(row[5] or 0),
+            "progress_total": int(row[6] or 0),
+            "attempts": int(row[7] or 0),
+            "error": row[8],
+            "file_name": row[9],
+            "result_bucket": row[10],
+            "result_blob_path": row[11],
+            "result_size": row[12],
+            "created_at": _iso(row[13]),
+            "started_at": _iso(row[14]),
+            "finished_at": _iso(row[15]),
+        }
+
+    def create_export_job(self, kind, requester_id, params):
+        """Поставить выгрузку в очередь. Та же незавершённая выгрузка того же
+        человека не дублируется: второй клик по кнопке получает первую задачу."""
+        params_json = Json(params or {})
+        with self._get_cursor() as cursor:
+            cursor.execute(f"""
+                SELECT {EXPORT_JOB_COLUMNS_SQL}
+                FROM export_jobs
+                WHERE kind = %s AND requester_id = %s AND params = %s::jsonb
+                  AND status IN ('queued', 'running')
+                ORDER BY id DESC
+                LIMIT 1
+            """, (kind, requester_id, params_json))
+            row = cursor.fetchone()
+            if row:
+                return self._serialize_export_job(row)
+            cursor.execute(f"""
+                INSERT INTO export_jobs (kind, requester_id, params)
+                VALUES (%s, %s, %s)
+                RETURNING {EXPORT_JOB_COLUMNS_SQL}
+            """, (kind, requester_id, params_json))
+            return self._serialize_export_job(cursor.fetchone())
+
+    def claim_export_job(self, worker, stale_seconds, max_attempts):
+        """Выдать воркеру следующую задачу: из очереди или брошенную (heartbeat протух).
+
+        Брошенная задача, исчерпавшая попытки, сначала закрывается ошибкой — иначе
+        выгрузка, стабильно роняющая процесс, крутилась бы по кругу."""
+        with self._get_cursor() as cursor:
+            cursor.execute("""
+                WITH abandoned AS (
+                    UPDATE export_jobs
+                    SET status = 'failed',
+                        error = COALESCE(error, 'Выгрузка прервалась и исчерпала попытки'),
+                        finished_at = NOW()
+                    WHERE status = 'running'
+                      AND heartbeat_at < NOW() - make_interval(secs => %s)
+                      AND attempts >= %s
+                    RETURNING id
+                )
+                DELETE FROM export_job_chunks WHERE job_id IN (SELECT id FROM abandoned)
+            """, (float(stale_seconds), int(max_attempts)))
+            cursor.execute(f"""
+                UPDATE export_jobs j
+                SET status = 'running',
+                    worker = %s,
+                    attempts = j.attempts + 1,
+                    started_at = COALESCE(j.started_at, NOW()),
+                    heartbeat_at = NOW(),
+                    retry_at = NULL,
+                    error = NULL
+                WHERE j.id = (
+                    SELECT id FROM export_jobs
+                    WHERE (status = 'queued' AND (retry_at IS NULL OR retry_at <= NOW()))
+                       OR (status = 'running'
+                           AND heartbeat_at < NOW() - make_interval(secs => %s)
+                           AND attempts < %s)
+                    ORDER BY created_at, id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING {EXPORT_JOB_COLUMNS_SQL}
+            """, (str(worker), float(stale_seconds), int(max_attempts)))
+            return self._serialize_export_job(cursor.fetchone())
+
+    def get_export_job(self, job_id):
+        with self._get_cursor() as cursor:
+            cursor.execute(f"""
+                SELECT {EXPORT_JOB_COLUMNS_SQL}
+                FROM export_jobs
+                WHERE id = %s
+            """, (int(job_id),))
+            return self._serialize_export_job(cursor.fetchone())
+
+    def list_export_jobs(self, requester_id, limit=20):
+        with self._get_cursor() as cursor:
+            cursor.execute(f"""
+                SELECT {EXPORT_JOB_COLUMNS_SQL}
+                FROM export_jobs
+                WHERE requester_id = %s
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            """, (int(requester_id), max(1, min(100, int(limit or 20)))))
+            return [self._serialize_export_job(row) for row in cursor.fetchall()]
+
+    def get_export_job_chunks(self, job_id):
+        """{единица: результат} — чекпоинты задачи."""
+        with self._get_cursor() as cursor:
+            cursor.execute("""
+                SELECT unit, payload
+                FROM export_job_chunks
+                WHERE job_id = %s
+            """, (int(job_id),))
+            return {
+                unit: (json.loads(payload) if isinstance(payload, str) else payload)
+                for unit, payload in cursor.fetchall()
+            }
+
+    def save_export_job_chunk(self, job_id, unit, payload, done, total):
+        """Чекпоинт единицы и прогресс задачи — одной транзакцией."""
+        with self._get_cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO export_job_chunks (job_id, unit, payload)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (job_id, unit) DO UPDATE SET
+                    payload = EXCLUDED.payload,
+                    created_at = NOW()
+            """, (int(job_id), str(unit), Json(payload)))
+            cursor.execute("""
+                UPDATE export_jobs
+                SET progress_done = %s, progress_total = %s, heartbeat_at = NOW()
+                WHERE id = %s
+            """, (int(done), int(total), int(job_id)))
+
+    def touch_export_job(self, job_id):
+        with self._get_cursor() as cursor:
+            cursor.execute("""
+                UPDATE export_jobs SET heartbeat_at = NOW()
+                WHERE id = %s AND status = 'running'
+            """, (int(job_id),))
+
+    def finish_export_job(self, job_id, file_name, bucket, blob_path, size):
+        with self._get_cursor() as cursor:
+            cursor.execute("""
+                UPDATE export_jobs
+                SET status = 'done',
+                    progress_done = GREATEST(progress_done, progress_total),
+                    file_name = %s,
+                    result_bucket = %s,
+                    result_blob_path = %s,
+                    result_size = %s,
+                    error = NULL,
+                    finished_at = NOW()
+                WHERE id = %s
+            """, (file_name, bucket, blob_path, int(size or 0), int(job_id)))
+            cursor.execute("DELETE FROM export_job_chunks WHERE job_id = %s", (int(job_id),))
+
+    def fail_export_job(self, job_id, error, retry=False, retry_delay_seconds=0):
+        """Ошибка задачи. retry — вернуть в очередь: чекпоинты остаются, и следующий
+        заход досчитает только недостающие единицы. Задача не выдаётся раньше, чем
+        через retry_delay_seconds."""
+        with self._get_cursor() as cursor:
+            if retry:
+                cursor.execute("""
+                    UPDATE export_jobs
+                    SET status = 'queued', error = %s, worker = NULL, heartbeat_at = NULL,
+                        retry_at = NOW() + make_interval(secs => %s)
+                    WHERE id = %s
+                """, (error, max(0.0, float(retry_delay_seconds or 0)), int(job_id)))
+                return
+            cursor.execute("""
+                UPDATE export_jobs
+                SET status = 'failed', error = %s, finished_at = NOW()
+                WHERE id = %s
+            """, (error, int(job_id)))
+            cursor.execute("DELETE FROM export_job_chunks WHERE job_id = %s", (int(job_id),))
+
+    # --- «Биллинг Oktell»: агрегаты закрытых суток ----------------------------------------------
+    def _init_oktell_billing_days_schema_tx(self, cursor):
+        """Агрегаты «Биллинга Oktell» за закрытые сутки.
+
+        Одна строка — один день одного вида отчёта (park / line / operator_calls /
+        operator_states) при одном «варианте» запроса (окно минут, порог SL): в rows
+        лежат строки ровно той зернистости, что вернул SQL Oktell (день × парк [× линия],
+        день × оператор). Пустой массив — «звонков не было», а не «ещё не считали».
+        formula_version — версия SQL вида на момент расчёта; строки другой версии не читаются.
+        """
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS oktell_billing_days (
+                kind            TEXT NOT NULL,
+                variant         TEXT NOT NULL,
+                report_date     DATE NOT NULL,
+                formula_version INTEGER NOT NULL,
+                rows            JSONB NOT NULL DEFAULT '[]'::jsonb,
+                fetched_at      TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (kind, variant, report_date)
+            );
+            CREATE INDEX IF NOT EXISTS idx_oktell_billing_days_date
+                ON oktell_billing_days(report_date);
+        """)
+
+    def get_oktell_billing_days(self, kind, variant, date_from, date_to, formula_version):
+        """{date: rows} по закрытым суткам периода, посчитанным текущей версией формулы."""
+        with self._get_cursor() as cursor:
+            cursor.execute("""
+                SELECT report_date, rows
+                FROM oktell_billing_days
+                WHERE kind = %s AND variant = %s
+                  AND report_date BETWEEN %s AND %s
+                  AND formula_version = %s
+            """, (kind, variant, date_from, date_to, int(formula_version)))
+            return {
+                report_date: (rows if isinstance(rows, list) else json.loads(rows or '[]'))
+                for report_date, rows in cursor.fetchall()
+            }
+
+    def save_oktell_billing_days(self, kind, variant, days, formula_version):
+        """days — {date: rows}. Перезаписывает сутки целиком (в том числе старой версии)."""
+        values = [
+            (kind, variant, report_date, int(formula_version), Json(list(rows or [])))
+            for report_date, rows in (days or {}).items()
+        ]
+        if not values:
+            return 0
+        with self._get_cursor() as cursor:
+            execute_values(cursor, """
+                INSERT INTO oktell_billing_days (kind, variant, report_date, formula_version, rows)
+                VALUES %s
+                ON CONFLICT (kind, variant, report_date) DO UPDATE
+                SET formula_version = EXCLUDED.formula_version,
+                    rows = EXCLUDED.rows,
+                    fetched_at = NOW()
+            """, values)
+        return len(values)
+
+    def delete_oktell_billing_days(self, date_from=None, date_to=None, kind=None):
+        """Сброс кэша (все варианты) за период — например, после правки данных в Oktell
+        задним числом. Без аргументов чистит всё. Возвращает число удалённых суток."""
+        conditions = []
+        params = []
+        if date_from is not None:
+            conditions.append("report_date >= %s")
+            params.append(date_from)
+        if date_to is not None:
+            conditions.append("report_date <= %s")
+            params.append(date_to)
+        if kind:
+            conditions.append("kind = %s")
+            params.append(kind)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._get_cursor() as cursor:
+            cursor.execute(f"DELETE FROM oktell_billing_days {where}", tuple(params))
+            return cursor.rowcount
+
     def _init_amo_leads_schema_tx(self, cursor):
         """Схема выгрузки сделок amoCRM (раздел «Лиды по источникам»).
 
@@ -6937,6 +7592,7 @@ class Database:
             "work_hours.rate backfill: проставлено %s помесячных ставок для %s операторов",
             len(updates), len({u[1] for u in updates}),
         )
+        self._reset_operator_month_rollups_tx(cursor)
 
     def _backfill_groups_from_supervisors_tx(self, cursor):
         """
@@ -7085,6 +7741,7 @@ class Database:
             "проставлен group_id: daily_hours=%s, work_hours=%s",
             groups_created, sv_memberships, op_memberships, daily_stamped, work_stamped,
         )
+        self._reset_operator_month_rollups_tx(cursor)
 
     def _backfill_user_profiles_tx(self, cursor):
         """
@@ -8874,46 +9531,40 @@ class Database:
                 SHIFT_AUCTION_PARTICIPANT_CACHE["expires_at"] = time.time() + SHIFT_AUCTION_PARTICIPANT_CACHE_TTL_SECONDS
         return participant_ids
 
-    def _shift_auction_snapshot_common_cache_key(self, settings_row, include_admin_fields):
-        if not settings_row:
-            return None
+    def _shift_auction_snapshot_version(self, settings_row):
         # settings_row tail layout: ... published_to_work_schedules_by_name,
         # topup_started_at, topup_started_by, topup_started_by_name, last_event_id.
         # Probe the last position since the same row shape feeds multiple callers.
-        last_event_id = settings_row[-1] if isinstance(settings_row, (list, tuple)) and len(settings_row) >= 14 else 0
+        if not isinstance(settings_row, (list, tuple)) or len(settings_row) < 14:
+            return 0
+        return int(settings_row[-1] or 0)
+
+    def _shift_auction_snapshot_common_cache_key(self, settings_row, include_admin_fields):
+        if not settings_row:
+            return None
+        # Версия в ключ не входит: она хранится в записи, чтобы снимок прошлой
+        # версии можно было довести до текущей патчем, а не собирать заново.
         return (
             bool(include_admin_fields),
-            int(last_event_id or 0),
             int(settings_row[6]) if settings_row[6] is not None else None
         )
 
-    def _build_shift_auction_snapshot_common_tx(self, cursor, settings_row, include_admin_fields=False):
-        cursor.execute("""
-            SELECT
-                u.id,
-                u.name,
-                u.role,
-                u.status,
-                u.rate,
-                u.direction_id,
-                d.name AS direction_name,
-                u.supervisor_id,
-                s.name AS supervisor_name,
-                p.created_at
-            FROM shift_auction_test_participants p
-            JOIN users u ON u.id = p.operator_id
-            JOIN directions d ON d.id = u.direction_id
-            JOIN departments dep ON dep.id = d.department_id
-            LEFT JOIN users s ON s.id = u.supervisor_id
-            WHERE BTRIM(COALESCE(d.name, '')) = %s
-              AND LOWER(BTRIM(COALESCE(dep.code, ''))) = %s
-              AND LOWER(COALESCE(u.role, '')) = 'operator'
-              AND COALESCE(u.status, '') NOT IN ('fired', 'dismissal')
-            ORDER BY u.name
-        """, (SHIFT_AUCTION_DIRECTION_NAME, SHIFT_AUCTION_DEPARTMENT_CODE))
-        participant_rows = cursor.fetchall() or []
-        self._cache_shift_auction_participant_ids(participant_rows)
-
+    def _fetch_shift_auction_lot_rows_tx(self, cursor, lot_ids=None, source_pairs=None):
+        """Строки лотов для снимка: все или только затронутые (по id и по смене-источнику)."""
+        where_sql = ""
+        params = ()
+        if lot_ids is not None or source_pairs is not None:
+            pairs = sorted(source_pairs or ())
+            where_sql = """
+            WHERE l.id = ANY(%s::int[])
+               OR (l.source_schedule_plan_id, l.source_schedule_shift_id) IN (
+                   SELECT * FROM UNNEST(%s::int[], %s::int[])
+               )"""
+            params = (
+                sorted(lot_ids or ()),
+                [pair[0] for pair in pairs],
+                [pair[1] for pair in pairs],
+            )
         cursor.execute("""
             SELECT
                 l.id,
@@ -8960,9 +9611,78 @@ class Database:
             LEFT JOIN directions claimed_dir ON claimed_dir.id = u.direction_id
             LEFT JOIN resource_saved_schedule_shifts source_shift ON source_shift.id = l.source_schedule_shift_id
             LEFT JOIN users added_user ON added_user.id = l.added_by
+            {where_sql}
             ORDER BY l.shift_date, l.start_time, l.id
-        """)
-        lot_rows = cursor.fetchall() or []
+        """.format(where_sql=where_sql), params or None)
+        return cursor.fetchall() or []
+
+    def _fetch_shift_auction_claim_journal_rows_tx(self, cursor, plan_id):
+        cursor.execute("""
+            SELECT
+                e.id,
+                e.created_at,
+                NULLIF(e.payload->'lot'->>'shift_date', '') AS shift_date,
+                NULLIF(e.payload->'lot'->>'start_time', '') AS start_time,
+                NULLIF(e.payload->'lot'->>'end_time', '') AS end_time,
+                COALESCE(
+                    NULLIF(e.payload->'lot'->>'claimed_by', ''),
+                    NULLIF(e.payload->>'operator_id', '')
+                )::INTEGER AS claimed_by,
+                COALESCE(u.name, NULLIF(e.payload->>'operator_name', ''), '') AS claimed_by_name,
+                NULLIF(e.payload->'lot'->>'source_schedule_plan_id', '')::INTEGER AS source_schedule_plan_id,
+                p.date_from,
+                p.date_to
+            FROM shift_auction_test_events e
+            LEFT JOIN users u
+              ON u.id = COALESCE(
+                  NULLIF(e.payload->'lot'->>'claimed_by', ''),
+                  NULLIF(e.payload->>'operator_id', '')
+              )::INTEGER
+            LEFT JOIN resource_saved_schedule_plans p
+              ON p.id = NULLIF(e.payload->'lot'->>'source_schedule_plan_id', '')::INTEGER
+            WHERE e.event_type = 'lot_claimed'
+              AND NULLIF(e.payload->'lot'->>'source_schedule_plan_id', '')::INTEGER = %s
+            ORDER BY e.id DESC
+            LIMIT 50
+        """, (plan_id,))
+        return cursor.fetchall() or []
+
+    def _shift_auction_self_schedule_operator_ids(self, time_groups, plan_id):
+        return {
+            operator_id
+            for group in time_groups or []
+            if group.get("self_schedule_enabled") and group.get("plan_id") == plan_id
+            for operator_id in (group.get("operator_ids") or [])
+        }
+
+    def _build_shift_auction_snapshot_common_tx(self, cursor, settings_row, include_admin_fields=False):
+        cursor.execute("""
+            SELECT
+                u.id,
+                u.name,
+                u.role,
+                u.status,
+                u.rate,
+                u.direction_id,
+                d.name AS direction_name,
+                u.supervisor_id,
+                s.name AS supervisor_name,
+                p.created_at
+            FROM shift_auction_test_participants p
+            JOIN users u ON u.id = p.operator_id
+            JOIN directions d ON d.id = u.direction_id
+            JOIN departments dep ON dep.id = d.department_id
+            LEFT JOIN users s ON s.id = u.supervisor_id
+            WHERE BTRIM(COALESCE(d.name, '')) = %s
+              AND LOWER(BTRIM(COALESCE(dep.code, ''))) = %s
+              AND LOWER(COALESCE(u.role, '')) = 'operator'
+              AND COALESCE(u.status, '') NOT IN ('fired', 'dismissal')
+            ORDER BY u.name
+        """, (SHIFT_AUCTION_DIRECTION_NAME, SHIFT_AUCTION_DEPARTMENT_CODE))
+        participant_rows = cursor.fetchall() or []
+        self._cache_shift_auction_participant_ids(participant_rows)
+
+        lot_rows = self._fetch_shift_auction_lot_rows_tx(cursor)
         lots = [self._serialize_shift_auction_lot_row(row) for row in lot_rows]
         lot_dates = sorted({row[1] for row in lot_rows if row and row[1]})
 
@@ -8977,42 +9697,11 @@ class Database:
         if include_admin_fields:
             participant_workloads = self._get_shift_auction_participant_workloads_tx(
                 cursor, participant_rows, lots, lot_dates,
-                self_schedule_operator_ids={
-                    operator_id
-                    for group in time_groups
-                    if group.get("self_schedule_enabled") and group.get("plan_id") == settings_row[6]
-                    for operator_id in (group.get("operator_ids") or [])
-                }
+                self_schedule_operator_ids=self._shift_auction_self_schedule_operator_ids(
+                    time_groups, settings_row[6]
+                )
             )
-            cursor.execute("""
-                SELECT
-                    e.id,
-                    e.created_at,
-                    NULLIF(e.payload->'lot'->>'shift_date', '') AS shift_date,
-                    NULLIF(e.payload->'lot'->>'start_time', '') AS start_time,
-                    NULLIF(e.payload->'lot'->>'end_time', '') AS end_time,
-                    COALESCE(
-                        NULLIF(e.payload->'lot'->>'claimed_by', ''),
-                        NULLIF(e.payload->>'operator_id', '')
-                    )::INTEGER AS claimed_by,
-                    COALESCE(u.name, NULLIF(e.payload->>'operator_name', ''), '') AS claimed_by_name,
-                    NULLIF(e.payload->'lot'->>'source_schedule_plan_id', '')::INTEGER AS source_schedule_plan_id,
-                    p.date_from,
-                    p.date_to
-                FROM shift_auction_test_events e
-                LEFT JOIN users u
-                  ON u.id = COALESCE(
-                      NULLIF(e.payload->'lot'->>'claimed_by', ''),
-                      NULLIF(e.payload->>'operator_id', '')
-                  )::INTEGER
-                LEFT JOIN resource_saved_schedule_plans p
-                  ON p.id = NULLIF(e.payload->'lot'->>'source_schedule_plan_id', '')::INTEGER
-                WHERE e.event_type = 'lot_claimed'
-                  AND NULLIF(e.payload->'lot'->>'source_schedule_plan_id', '')::INTEGER = %s
-                ORDER BY e.id DESC
-                LIMIT 50
-            """, (settings_row[6],))
-            claim_journal_rows = cursor.fetchall() or []
+            claim_journal_rows = self._fetch_shift_auction_claim_journal_rows_tx(cursor, settings_row[6])
 
         return {
             "participant_rows": participant_rows,
@@ -9030,27 +9719,129 @@ class Database:
         if not cache_key or SHIFT_AUCTION_SNAPSHOT_CACHE_TTL_SECONDS <= 0:
             return self._build_shift_auction_snapshot_common_tx(cursor, settings_row, include_admin_fields)
 
-        now = time.time()
+        version = self._shift_auction_snapshot_version(settings_row)
         with SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE_LOCK:
-            if (
-                SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE["key"] == cache_key
-                and SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE["expires_at"] > now
-                and SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE["value"] is not None
-            ):
-                return SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE["value"]
+            now = time.time()
+            entry = SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE.get(cache_key)
+            if entry is not None:
+                if entry["version"] == version and entry["refreshed_at"] + SHIFT_AUCTION_SNAPSHOT_CACHE_TTL_SECONDS > now:
+                    return entry["value"]
+                # Снимок прошлой версии доводим патчем: после взятия лота все клиенты
+                # разом перечитывают снимок, и пересобирать ради одного лота весь
+                # список лотов и нагрузку всех участников незачем.
+                if (
+                    entry["version"] < version
+                    and entry["built_at"] + SHIFT_AUCTION_SNAPSHOT_PATCH_MAX_AGE_SECONDS > now
+                ):
+                    value = self._patch_shift_auction_snapshot_common_tx(
+                        cursor, entry["value"], entry["version"], version, settings_row, include_admin_fields
+                    )
+                    if value is not None:
+                        entry.update(version=version, refreshed_at=time.time(), value=value)
+                        return value
 
             value = self._build_shift_auction_snapshot_common_tx(cursor, settings_row, include_admin_fields)
-            SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE["key"] = cache_key
-            SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE["value"] = value
-            SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE["expires_at"] = time.time() + SHIFT_AUCTION_SNAPSHOT_CACHE_TTL_SECONDS
+            built_at = time.time()
+            SHIFT_AUCTION_SNAPSHOT_COMMON_CACHE[cache_key] = {
+                "version": version,
+                "built_at": built_at,
+                "refreshed_at": built_at,
+                "value": value,
+            }
             return value
 
+    def _get_shift_auction_changes_scope_tx(self, cursor, since_version, version):
+        """Сводка событий (since_version, version] — см. _shift_auction_events_patch_scope."""
+        since_version = int(since_version or 0)
+        version = int(version or 0)
+        if version == since_version:
+            return _shift_auction_events_patch_scope([])
+        if version < since_version or version - since_version > SHIFT_AUCTION_SNAPSHOT_PATCH_MAX_EVENTS:
+            return None
+        cursor.execute("""
+            SELECT event_type, payload
+            FROM shift_auction_test_events
+            WHERE id > %s AND id <= %s
+            ORDER BY id
+        """, (since_version, version))
+        return _shift_auction_events_patch_scope(cursor.fetchall() or [])
+
+    def _patch_shift_auction_snapshot_common_tx(
+        self, cursor, base, base_version, version, settings_row, include_admin_fields
+    ):
+        """Довести общий снимок версии base_version до version или вернуть None.
+
+        Перечитываются только лоты, названные событиями (и лоты их смен-источников),
+        и нагрузка затронутых операторов. None — патч невозможен (структурное
+        событие, слишком длинный хвост, поменялся набор дат), нужна полная сборка.
+        """
+        scope = self._get_shift_auction_changes_scope_tx(cursor, base_version, version)
+        if scope is None:
+            return None
+        base_lots = base["lots"]
+        changed_ids = _shift_auction_scope_lot_ids(base_lots, scope)
+        fresh_lots = []
+        if scope["lot_ids"] or scope["source_pairs"]:
+            fresh_lots = [
+                self._serialize_shift_auction_lot_row(row)
+                for row in self._fetch_shift_auction_lot_rows_tx(
+                    cursor, lot_ids=scope["lot_ids"], source_pairs=scope["source_pairs"]
+                )
+            ]
+        changed_ids = changed_ids | {int(lot["id"]) for lot in fresh_lots}
+        lots = _merge_shift_auction_lots(base_lots, fresh_lots, changed_ids)
+        lot_dates = sorted({
+            datetime.strptime(lot["shift_date"], '%Y-%m-%d').date()
+            for lot in lots
+            if lot.get("shift_date")
+        })
+        if lot_dates != list(base["lot_dates"]):
+            # Норма каждого участника считается от числа дней аукциона.
+            return None
+
+        value = {**base, "lots": lots}
+        if include_admin_fields:
+            operator_ids = set(scope["operator_ids"])
+            for lot in base_lots:
+                if int(lot["id"]) in changed_ids:
+                    operator_ids |= _shift_auction_lot_operator_ids(lot)
+            for lot in fresh_lots:
+                operator_ids |= _shift_auction_lot_operator_ids(lot)
+            if operator_ids:
+                fresh_workloads = {
+                    workload["operator_id"]: workload
+                    for workload in self._get_shift_auction_participant_workloads_tx(
+                        cursor,
+                        [row for row in base["participant_rows"] if row and row[0] in operator_ids],
+                        lots,
+                        lot_dates,
+                        self_schedule_operator_ids=self._shift_auction_self_schedule_operator_ids(
+                            base["time_groups"], settings_row[6]
+                        ),
+                    )
+                }
+                value["participant_workloads"] = [
+                    fresh_workloads.get(workload["operator_id"], workload)
+                    for workload in base["participant_workloads"]
+                ]
+            if "lot_claimed" in scope["event_types"]:
+                value["claim_journal_rows"] = self._fetch_shift_auction_claim_journal_rows_tx(cursor, settings_row[6])
+        return value
+
     def _insert_shift_auction_test_event(self, cursor, event_type, payload):
+        # Порядок важен для устоявшейся версии снимка: xid транзакции выдаётся ДО
+        # её id события (txid_current() стоит в списке первым), а settle_xmax берётся
+        # снимком следующей команды — уже ПОСЛЕ nextval. Тогда любая транзакция,
+        # получившая меньший id, имеет xid < settle_xmax этого события.
+        cursor.execute(
+            "SELECT txid_current(), nextval(pg_get_serial_sequence('shift_auction_test_events', 'id'))"
+        )
+        allocated_id = cursor.fetchone()[1]
         cursor.execute("""
-            INSERT INTO shift_auction_test_events (event_type, payload)
-            VALUES (%s, %s)
+            INSERT INTO shift_auction_test_events (id, event_type, payload, settle_xmax)
+            VALUES (%s, %s, %s, txid_snapshot_xmax(txid_current_snapshot()))
             RETURNING id, created_at
-        """, (str(event_type or '').strip()[:64], Json(payload or {})))
+        """, (allocated_id, str(event_type or '').strip()[:64], Json(payload or {})))
         row = cursor.fetchone()
         event_id = row[0] if row else None
         if event_id is not None:
@@ -11396,7 +12187,15 @@ class Database:
         output.seek(0)
         return output, start_date_obj, end_date_obj
 
-    def get_shift_auction_test_snapshot(self, current_user_id=None, include_admin_fields=False):
+    def get_shift_auction_test_snapshot(self, current_user_id=None, include_admin_fields=False, since_version=None):
+        """Снимок аукциона для зрителя.
+
+        since_version — версия (last_event_id), которая уже есть у клиента. Если всё,
+        что случилось после неё, — события отдельных лотов, снимок приходит дельтой:
+        "delta": true, в lots только изменённые лоты, в participant_workloads —
+        нагрузка затронутых операторов, removed_lot_ids — исчезнувшие лоты. Иначе
+        (структурное событие, слишком старая версия) — полный снимок, как без неё.
+        """
         current_id = None
         try:
             current_id = int(current_user_id) if current_user_id is not None else None
@@ -11431,7 +12230,7 @@ class Database:
                     s.topup_started_at,
                     s.topup_started_by,
                     topup_user.name AS topup_started_by_name,
-                    (SELECT COALESCE(MAX(id), 0) FROM shift_auction_test_events) AS last_event_id
+                    (""" + SHIFT_AUCTION_SETTLED_VERSION_SQL + """) AS last_event_id
                 FROM shift_auction_test_access s
                 LEFT JOIN users u ON u.id = s.updated_by
                 LEFT JOIN users publisher ON publisher.id = s.published_to_work_schedules_by
@@ -11452,6 +12251,11 @@ class Database:
                 settings_row,
                 include_admin_fields=include_admin_fields
             )
+            delta_scope = None
+            if since_version is not None:
+                delta_scope = self._get_shift_auction_changes_scope_tx(
+                    cursor, since_version, self._shift_auction_snapshot_version(settings_row)
+                )
             participant_rows = common_snapshot["participant_rows"]
             lots = common_snapshot["lots"]
             lot_dates = common_snapshot["lot_dates"]
@@ -11517,7 +12321,7 @@ class Database:
             self.get_admin_post_claim_notify_setting(current_id)
             if include_admin_fields and current_id is not None else False
         )
-        return {
+        snapshot = {
             "enabled": bool(settings_row[0]) if settings_row else False,
             "launch_note": settings_row[1] or "",
             "starts_at": settings_row[2].isoformat() if settings_row and settings_row[2] else None,
@@ -11593,6 +12397,24 @@ class Database:
             "post_auction_active": post_auction_active,
             "notify_post_claim_enabled": notify_post_claim_enabled,
         }
+        snapshot["snapshot_version"] = snapshot["last_event_id"]
+        if delta_scope is not None:
+            changed_ids = _shift_auction_scope_lot_ids(lots, delta_scope)
+            delta_lots = [lot for lot in lots if int(lot["id"]) in changed_ids]
+            operator_ids = set(delta_scope["operator_ids"])
+            for lot in delta_lots:
+                operator_ids |= _shift_auction_lot_operator_ids(lot)
+            snapshot.update({
+                "delta": True,
+                "since_version": int(since_version),
+                "lots": delta_lots,
+                "removed_lot_ids": sorted(delta_scope["lot_ids"] - {int(lot["id"]) for lot in lots}),
+                "participant_workloads": [
+                    workload for workload in participant_workloads
+                    if workload.get("operator_id") in operator_ids
+                ],
+            })
+        return snapshot
 
     def get_shift_auction_period_preview(self, schedule_plan_id, current_user_id=None):
         current_id = None
@@ -12489,12 +13311,67 @@ class Database:
                 for row in (cursor.fetchall() or [])
             ]
 
-    def claim_shift_auction_test_lot(self, operator_id, lot_id):
+    @contextmanager
+    def _shift_auction_claim_cursor(self, cursor=None):
+        """Своя транзакция — или savepoint в чужой, когда захват идёт пачкой.
+
+        Пачку проводит движок захватов (shift_auction_engine.py): отказ одного
+        запроса откатывает только его savepoint, соседи по пачке фиксируются.
+        """
+        if cursor is None:
+            with self._get_cursor() as own_cursor:
+                yield own_cursor
+            return
+        cursor.execute("SAVEPOINT shift_auction_claim")
+        try:
+            yield cursor
+        except Exception:
+            cursor.execute("ROLLBACK TO SAVEPOINT shift_auction_claim")
+            raise
+        cursor.execute("RELEASE SAVEPOINT shift_auction_claim")
+
+    def process_shift_auction_lot_batch(self, requests):
+        """Пачка захватов/отказов [(action, operator_id, lot_id), ...] одной транзакцией.
+
+        Возвращает по исходу на запрос в том же порядке: dict результата или
+        исключение. Ошибка самой транзакции (фиксация, обрыв) поднимается
+        наружу — тогда ни один запрос пачки не записан.
+        """
+        outcomes = []
+        with self._get_cursor() as cursor:
+            for action, operator_id, lot_id in requests:
+                handler = (
+                    self.release_shift_auction_test_lot if action == 'release'
+                    else self.claim_shift_auction_test_lot
+                )
+                try:
+                    outcomes.append(handler(operator_id, lot_id, cursor=cursor))
+                except Exception as error:
+                    outcomes.append(error)
+        return outcomes
+
+    def get_shift_auction_lot_states(self):
+        """(устоявшийся id события, {lot_id: status}) одним запросом — один снимок.
+
+        Версия — не MAX(id): событие с меньшим id может зафиксироваться позже, и движок,
+        начавший с MAX(id), никогда не применил бы его (см. SHIFT_AUCTION_SETTLED_VERSION_SQL).
+        """
+        with self._get_cursor() as cursor:
+            cursor.execute("""
+                SELECT e.max_id, l.id, l.status
+                FROM (SELECT (""" + SHIFT_AUCTION_SETTLED_VERSION_SQL + """) AS max_id) e
+                LEFT JOIN shift_auction_test_lots l ON TRUE
+            """)
+            rows = cursor.fetchall() or []
+        version = int(rows[0][0] or 0) if rows else 0
+        return version, {int(row[1]): row[2] for row in rows if row[1] is not None}
+
+    def claim_shift_auction_test_lot(self, operator_id, lot_id, cursor=None):
         operator_id = int(operator_id)
         lot_id = int(lot_id)
         timings = {}
         lock_started_at = time.perf_counter()
-        with self._get_cursor() as cursor:
+        with self._shift_auction_claim_cursor(cursor) as cursor:
             self._lock_shift_auction_operator_tx(cursor, operator_id)
             timings["lock"] = (time.perf_counter() - lock_started_at) * 1000
             started_at = time.perf_counter()
@@ -12700,10 +13577,10 @@ class Database:
             timings["write"] = timings["cas_update"] + timings["event"]
         return {"lot": lot_payload, "event": event, "_timings": timings}
 
-    def release_shift_auction_test_lot(self, operator_id, lot_id):
+    def release_shift_auction_test_lot(self, operator_id, lot_id, cursor=None):
         operator_id = int(operator_id)
         lot_id = int(lot_id)
-        with self._get_cursor() as cursor:
+        with self._shift_auction_claim_cursor(cursor) as cursor:
             self._lock_shift_auction_operator_tx(cursor, operator_id)
             cursor.execute("""
                 SELECT
@@ -14601,6 +15478,10 @@ class Database:
             )
             if cursor.fetchone() is None:
                 return None
+        if 'is_active' in updates:
+            # Выключенный отдел перестаёт быть «возглавляемым» — кто его глава,
+            # здесь не видно, поэтому сбрасываем всех.
+            invalidate_user_principal_scope()
         return self.get_department_by_id(department_id)
 
     def set_department_head(self, department_id, user_id, changed_by=None):
@@ -14632,6 +15513,9 @@ class Database:
                         INSERT INTO department_head_assignments (department_id, user_id, action, changed_by)
                         VALUES (%s, %s, 'assigned', %s)
                     """, (department_id, new_head, changed_by))
+        if current_head != new_head:
+            invalidate_user_principal_scope(current_head)
+            invalidate_user_principal_scope(new_head)
         return self.get_department_by_id(department_id)
 
     def get_department_head_history(self, department_id):
@@ -14700,6 +15584,34 @@ class Database:
             r = cursor.fetchone()
             return r[0] if r else None
 
+    def get_user_principal_scope(self, user_id):
+        """Отдел пользователя и все возглавляемые им отделы одним запросом.
+
+        {'department_id': int|None, 'headed_department_ids': (int, ...)} или None,
+        если пользователя нет. Заменяет связку headed_department_id_for_user +
+        get_headed_departments_for_user + get_user_department_id, которую проверки
+        доступа делали на каждом запросе. Ответ кэшируется на процесс на
+        USER_PRINCIPAL_SCOPE_CACHE_TTL_SECONDS.
+        """
+        if not user_id:
+            return None
+        user_id = int(user_id)
+        with USER_PRINCIPAL_SCOPE_CACHE_LOCK:
+            cached = USER_PRINCIPAL_SCOPE_CACHE.get(user_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        with self._get_cursor() as cursor:
+            cursor.execute(
+                f"SELECT {USER_PRINCIPAL_SCOPE_COLUMNS_SQL} FROM users u WHERE u.id = %s",
+                (user_id,)
+            )
+            row = cursor.fetchone()
+        if not row:
+            return None
+        scope = _user_principal_scope_from_row(row[0], row[1])
+        _store_user_principal_scope(user_id, scope)
+        return scope
+
     def get_user_department(self, user_id):
         """Вернуть (department_id, department_code) пользователя одним запросом."""
         if not user_id:
@@ -14862,7 +15774,9 @@ class Database:
     def assign_user_department(self, user_id, department_id):
         with self._get_cursor() as cursor:
             cursor.execute("UPDATE users SET department_id = %s WHERE id = %s RETURNING id", (department_id, user_id))
-            return cursor.fetchone() is not None
+            updated = cursor.fetchone() is not None
+        invalidate_user_principal_scope(user_id)
+        return updated
 
     def upsert_daily_calls(self, operator_id, day, calls, group_id=None):
         """Обновляет ТОЛЬКО количество звонков (daily_hours.calls) за день оператора,
@@ -14883,9 +15797,13 @@ class Database:
                 DO UPDATE SET
                     calls = EXCLUDED.calls,
                     group_id = COALESCE(daily_hours.group_id, EXCLUDED.group_id)
-                RETURNING id
+                RETURNING id, (xmax = 0) AS inserted
             """, (operator_id, day, int(calls or 0), group_id))
             res = cursor.fetchone()
+            if res and res[1]:
+                self._refresh_operator_month_rollups_tx(
+                    cursor, operator_ids=[operator_id], months=[day.strftime('%Y-%m')]
+                )
             return res[0] if res else None
 
     @staticmethod
@@ -15221,6 +16139,11 @@ class Database:
                     values,
                     page_size=500,
                 )
+                self._refresh_operator_month_rollups_tx(
+                    cursor,
+                    operator_ids={row[0] for row in values},
+                    months={row[1].strftime("%Y-%m") for row in values},
+                )
 
         return {
             "date_from": start_obj.strftime("%Y-%m-%d"),
@@ -15271,12 +16194,18 @@ class Database:
                     fine_comment = EXCLUDED.fine_comment,
                     group_id = COALESCE(EXCLUDED.group_id, daily_hours.group_id),
                     created_at = CURRENT_TIMESTAMP
-                RETURNING id
+                RETURNING id, (xmax = 0) AS inserted
             """, (operator_id, day, work_time, break_time, talk_time, calls, efficiency,
                 float(fine_amount) if fine_amount is not None else 0.0,
                 fine_reason, fine_comment, group_id))
             res = cursor.fetchone()
             daily_id = res[0] if res else None
+            # Первая строка дня может сделать оператора видимым в месяце —
+            # обновление существующей свёртку не меняет.
+            if res and res[1]:
+                self._refresh_operator_month_rollups_tx(
+                    cursor, operator_ids=[operator_id], months=[day.strftime('%Y-%m')]
+                )
 
             # If fines provided, replace existing fines for this daily_hours record
             if daily_id and isinstance(fines, list):
@@ -22060,14 +22989,10 @@ class Database:
             # Получаем операторов + ставка + norm_hours + агрегаты work_hours (включая fines).
             # Колонка модели и источник операторов различаются: group-aware vs legacy,
             # но СПИСОК и ПОРЯДОК колонок идентичны (downstream-распаковка одна).
+            self._ensure_operator_month_rollup_tx(cursor, month)
             _sel_prefix = """
                 SELECT u.id, u.name,
-                    COALESCE(
-                        (SELECT wr.rate FROM work_hours wr
-                         WHERE wr.operator_id = u.id AND wr.rate IS NOT NULL AND wr.month <= %s
-                         ORDER BY wr.month DESC LIMIT 1),
-                        u.rate
-                    ) AS rate,
+                    """ + OPERATOR_MONTH_RATE_SQL + """ AS rate,
                     u.status, u.supervisor_id, u.hire_date,
                     d.name as direction_name,
             """
@@ -22094,13 +23019,14 @@ class Database:
                     -- прошлых месяцев. Роль/статус на конец месяца резолвятся отдельно (status_as_of).
                     JOIN users u ON u.id = gom.operator_id
                     LEFT JOIN work_hours w ON w.operator_id = u.id AND w.month = %s
+                    LEFT JOIN operator_month_rollups r ON r.operator_id = u.id AND r.month = %s
                     LEFT JOIN directions d ON u.direction_id = d.id
                     WHERE gom.group_id = %s
                       AND gom.start_date <= %s
                       AND (gom.end_date IS NULL OR gom.end_date >= %s)
                     ORDER BY u.name
                     """,
-                    (month, month, int(group_id), end, start),
+                    (month, month, month, int(group_id), end, start),
                 )
             else:
                 cursor.execute(
@@ -22110,11 +23036,12 @@ class Database:
                     + """
                     FROM users u
                     LEFT JOIN work_hours w ON w.operator_id = u.id AND w.month = %s
+                    LEFT JOIN operator_month_rollups r ON r.operator_id = u.id AND r.month = %s
                     LEFT JOIN directions d ON u.direction_id = d.id
                     WHERE u.role = 'operator' AND u.supervisor_id = %s
                     ORDER BY u.name
                     """,
-                    (month, month, supervisor_id),
+                    (month, month, month, supervisor_id),
                 )
             operator_rows = cursor.fetchall()  # list of tuples
 
@@ -22521,14 +23448,12 @@ class Database:
             raise ValueError("Invalid month format, expected YYYY-MM") from e
 
         with self._get_cursor() as cursor:
+            # Видимость и ставка — из свёртки «оператор × месяц» (индексный JOIN
+            # вместо EXISTS-сканов и подзапроса ставки на каждого пользователя).
+            self._ensure_operator_month_rollup_tx(cursor, month)
             cursor.execute("""
                 SELECT u.id, u.name,
-                    COALESCE(
-                        (SELECT wr.rate FROM work_hours wr
-                         WHERE wr.operator_id = u.id AND wr.rate IS NOT NULL AND wr.month <= %s
-                         ORDER BY wr.month DESC LIMIT 1),
-                        u.rate
-                    ) AS rate,
+                    """ + OPERATOR_MONTH_RATE_SQL + """ AS rate,
                     u.status, u.supervisor_id, u.hire_date,
                     d.name as direction_name,
                     d.calculation_model_code,
@@ -22544,20 +23469,19 @@ class Database:
                 FROM users u
                 LEFT JOIN work_hours w
                 ON w.operator_id = u.id AND w.month = %s
+                LEFT JOIN operator_month_rollups r ON r.operator_id = u.id AND r.month = %s
                 LEFT JOIN directions d ON u.direction_id = d.id
                 -- Историческая видимость: берём не только текущих операторов, но и всех,
                 -- кто был оператором В ЭТОМ МЕСЯЦЕ (есть daily_hours или членство в группе),
                 -- даже если сейчас стал СВ/уволен. Иначе прошлый отчёт «теряет» людей.
                 WHERE (
                     u.role = 'operator'
-                    OR EXISTS (SELECT 1 FROM daily_hours dh WHERE dh.operator_id = u.id AND dh.day >= %s AND dh.day <= %s)
-                    OR EXISTS (SELECT 1 FROM group_operator_memberships gom
-                               WHERE gom.operator_id = u.id AND gom.start_date <= %s
-                                 AND (gom.end_date IS NULL OR gom.end_date >= %s))
+                    OR r.has_daily_hours
+                    OR r.has_membership
                 )
                 AND (%s::int IS NULL OR u.department_id = %s::int)
                 ORDER BY u.name
-            """, (month, month, start, end, end, start, department_id, department_id))
+            """, (month, month, month, department_id, department_id))
             operator_rows = cursor.fetchall()
 
             if not operator_rows:
@@ -23913,6 +24837,167 @@ class Database:
                     captured_at = EXCLUDED.captured_at
             """, (Json(payload or {}), float(captured_at or 0.0)))
 
+    # --- Общий кэш процессов --------------------------------------------------------------
+
+    # Как часто процесс подчищает протухшие записи общего кэша (попутно с записью).
+    SHARED_CACHE_PURGE_INTERVAL_SECONDS = 600
+
+    def shared_cache_get(self, key: str):
+        """(value, expires_at) живой записи общего кэша или (None, None)."""
+        with self._get_cursor() as cur:
+            cur.execute("""
+                SELECT value, EXTRACT(EPOCH FROM expires_at)
+                FROM shared_cache
+                WHERE cache_key = %s AND expires_at > NOW()
+            """, (key,))
+            row = cur.fetchone()
+        if not row:
+            return None, None
+        return row[0], float(row[1])
+
+    def shared_cache_put(self, key: str, value, ttl_seconds: float, keep_remaining_seconds=None):
+        """Положить значение на ttl_seconds и вернуть (value, expires_at) того, что лежит в итоге.
+
+        keep_remaining_seconds — не перетирать чужую запись, которой жить ещё дольше этого:
+        два процесса, промахнувшиеся разом, сойдутся на одном значении (для подписанных
+        ссылок это значит одну ссылку у всех и попадание в кэш браузера)."""
+        guard = ""
+        params = [key, Json(value), float(ttl_seconds)]
+        if keep_remaining_seconds is not None:
+            guard = "WHERE shared_cache.expires_at <= NOW() + %s * INTERVAL '1 second'"
+            params.append(float(keep_remaining_seconds))
+        with self._get_cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO shared_cache (cache_key, value, expires_at)
+                VALUES (%s, %s, NOW() + %s * INTERVAL '1 second')
+                ON CONFLICT (cache_key) DO UPDATE
+                SET value = EXCLUDED.value,
+                    expires_at = EXCLUDED.expires_at
+                {guard}
+                RETURNING value, EXTRACT(EPOCH FROM expires_at)
+            """, params)
+            row = cur.fetchone()
+            if row is None:
+                cur.execute("""
+                    SELECT value, EXTRACT(EPOCH FROM expires_at)
+                    FROM shared_cache WHERE cache_key = %s
+                """, (key,))
+                row = cur.fetchone()
+            now = time.time()
+            if now - getattr(self, '_shared_cache_purged_at', 0.0) >= self.SHARED_CACHE_PURGE_INTERVAL_SECONDS:
+                self._shared_cache_purged_at = now
+                cur.execute("DELETE FROM shared_cache WHERE expires_at < NOW()")
+        if not row:
+            return None, None
+        return row[0], float(row[1])
+
+    # --- Журнал прогонов джоб планировщика -------------------------------------------------
+
+    # Сколько дней хранится журнал и как часто процесс его подчищает (попутно с записью):
+    # джоба раз в минуту — это 1440 строк в сутки.
+    SCHEDULER_JOB_RUNS_RETENTION_DAYS = 30
+    SCHEDULER_JOB_RUNS_PURGE_INTERVAL_SECONDS = 6 * 3600
+
+    def record_scheduler_job_run(self, run: dict) -> None:
+        """Записать законченный прогон джобы (запись собирает scheduler_pools)."""
+        with self._get_cursor() as cur:
+            cur.execute("""
+                INSERT INTO scheduler_job_runs (
+                    job_id, pool, started_at, finished_at, duration_ms, ok, rows_processed,
+                    external_calls, queue_wait_ms, budget_wait_ms, interval_seconds, error
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (
+                run['job_id'], run.get('pool'), run['started_at'], run['finished_at'],
+                int(run['duration_ms']), bool(run['ok']), run.get('rows_processed'),
+                int(run.get('external_calls') or 0), int(run.get('queue_wait_ms') or 0),
+                int(run.get('budget_wait_ms') or 0), run.get('interval_seconds'),
+                run.get('error'),
+            ))
+            now = time.time()
+            if (now - getattr(self, '_scheduler_job_runs_purged_at', 0.0)
+                    >= self.SCHEDULER_JOB_RUNS_PURGE_INTERVAL_SECONDS):
+                self._scheduler_job_runs_purged_at = now
+                cur.execute(
+                    "DELETE FROM scheduler_job_runs WHERE started_at < NOW() - make_interval(days => %s)",
+                    (int(self.SCHEDULER_JOB_RUNS_RETENTION_DAYS),))
+
+    def get_scheduler_job_run_trends(self, days=7, bucket='day', job_id=None):
+        """Прогоны по джобам и периодам (час/день): число, сбои, p50/p95/максимум длительности,
+        строки, внешние вызовы, среднее ожидание пула. Сводит их scheduler_pools.trend_report."""
+        bucket = 'hour' if bucket == 'hour' else 'day'
+        days_int = max(1, min(int(days or 7), self.SCHEDULER_JOB_RUNS_RETENTION_DAYS))
+        params = [bucket, days_int]
+        job_filter = ""
+        if job_id:
+            job_filter = "AND job_id = %s"
+            params.append(str(job_id))
+        with self._get_cursor() as cur:
+            cur.execute(f"""
+                SELECT job_id,
+                       date_trunc(%s, started_at) AS bucket,
+                       COUNT(*),
+                       COUNT(*) FILTER (WHERE NOT ok),
+                       percentile_cont(0.5) WITHIN GROUP (ORDER BY duration_ms),
+                       percentile_cont(0.95) WITHIN GROUP (ORDER BY duration_ms),
+                       MAX(duration_ms),
+                       MAX(interval_seconds),
+                       SUM(rows_processed),
+                       SUM(external_calls),
+                       AVG(queue_wait_ms + budget_wait_ms)
+                FROM scheduler_job_runs
+                WHERE started_at >= NOW() - make_interval(days => %s)
+                  {job_filter}
+                GROUP BY job_id, bucket
+                ORDER BY job_id, bucket
+            """, params)
+            return [{
+                'job_id': r[0],
+                'bucket': r[1].isoformat() if r[1] else None,
+                'runs': int(r[2]),
+                'failures': int(r[3]),
+                'p50_ms': int(round(r[4])) if r[4] is not None else None,
+                'p95_ms': int(round(r[5])) if r[5] is not None else None,
+                'max_ms': r[6],
+                'interval_seconds': r[7],
+                'rows_processed': int(r[8]) if r[8] is not None else None,
+                'external_calls': int(r[9] or 0),
+                'pool_wait_avg_ms': int(round(r[10])) if r[10] is not None else 0,
+            } for r in cur.fetchall()]
+
+    def get_scheduler_job_runs(self, job_id=None, limit=50):
+        """Последние прогоны — всех джоб или одной, свежие сверху."""
+        limit_int = max(1, min(int(limit or 50), 500))
+        params = []
+        job_filter = ""
+        if job_id:
+            job_filter = "WHERE job_id = %s"
+            params.append(str(job_id))
+        params.append(limit_int)
+        with self._get_cursor() as cur:
+            cur.execute(f"""
+                SELECT id, job_id, pool, started_at, finished_at, duration_ms, ok, rows_processed,
+                       external_calls, queue_wait_ms, budget_wait_ms, interval_seconds, error
+                FROM scheduler_job_runs
+                {job_filter}
+                ORDER BY started_at DESC
+                LIMIT %s
+            """, params)
+            return [{
+                'id': int(r[0]),
+                'job_id': r[1],
+                'pool': r[2],
+                'started_at': r[3].isoformat() if r[3] else None,
+                'finished_at': r[4].isoformat() if r[4] else None,
+                'duration_ms': r[5],
+                'ok': r[6],
+                'rows_processed': r[7],
+                'external_calls': r[8],
+                'queue_wait_ms': r[9],
+                'budget_wait_ms': r[10],
+                'interval_seconds': r[11],
+                'error': r[12],
+            } for r in cur.fetchall()]
+
     # --- Отбивка показателей «Табло СЗоВ» в Telegram ---------------------------------------
 
     # Режимы получателя: каждая отбивка или только та, где есть отклонения от нормы.
@@ -26828,7 +27913,8 @@ class Database:
                     u.avatar_blob_path,
                     u.avatar_content_type,
                     u.avatar_file_size,
-                    u.avatar_updated_at
+                    u.avatar_updated_at,
+                    """ + USER_PRINCIPAL_SCOPE_COLUMNS_SQL + """
                 FROM user_sessions us
                 JOIN users u ON u.id = us.user_id
                 LEFT JOIN directions d ON d.id = u.direction_id
@@ -26853,7 +27939,11 @@ class Database:
                 "sensitive_data_unlocked": bool(row[11]),
                 "sensitive_data_unlocked_at": row[12],
             }
-            return session, tuple(row[13:])
+            # Портрет для проверок доступа едет тем же запросом, что и сессия:
+            # гварды маршрутов берут его отсюда, без своих походов в базу.
+            session["principal_scope"] = _user_principal_scope_from_row(row[33], row[34])
+            _store_user_principal_scope(user_id, session["principal_scope"])
+            return session, tuple(row[13:33])
 
     def rotate_user_session_token(
         self,
@@ -28473,8 +29563,13 @@ class Database:
                         ON CONFLICT (operator_id, month)
                         DO UPDATE SET rate = EXCLUDED.rate
                     """, (user_id, new_rate))
+                    # Перенос ставки задевает все месяцы оператора, включая прошлые,
+                    # «замороженные» выше на старом значении.
+                    self._refresh_operator_month_rollups_tx(cursor, operator_ids=[user_id])
 
-            return updated
+        if updated and field == 'department_id':
+            invalidate_user_principal_scope(user_id)
+        return updated
 
     def promote_operator_to_supervisor(self, user_id, changed_by=None):
         with self._get_cursor() as cursor:
@@ -32199,12 +33294,20 @@ class Database:
         offline_activities_map: Dict[int, Dict[int, List[Dict[str, Any]]]] = None,
         filename: str = None,
         include_supervisor: bool = False,
-        report_group_id: int = None
-    ) -> Tuple[str, bytes]:
+        report_group_id: int = None,
+        output=None
+    ) -> Tuple[str, Optional[bytes]]:
         """
         Генерирует xlsx с листами: Отработанные часы, Перерыв, Звонки, Эффективность,
         Штрафы, Бонусы, Тренинги, Тех. сбои, Офлайн активность, Без телефона.
 
+        Книга пишется потоково (xlsx_stream, xlsxwriter constant_memory): в памяти
+        одна строка на лист, а не весь отчёт. Поэтому листы заполняются строго
+        сверху вниз. Без output возвращается (filename, bytes), как раньше; с
+        output (файл или file-like) xlsx пишется прямо в него и возвращается
+        (filename, None) — так выгрузку отдела можно отдать из временного файла,
+        не держа копию в памяти.
+
         Правила форматирования (по заданию пользователя):
         - Все числовые данные пишем без дополнительного округления.
         - В Excel визуально показываем максимум 2 знака после запятой (через number format), без изменения фактического значения.
@@ -32667,9 +33770,8 @@ class Database:
         days_in_month = calendar.monthrange(year, mon)[1]
         days = list(range(1, days_in_month + 1))
 
-        wb = Workbook()
-        default = wb.active
-        wb.remove(default)
+        out = output if output is not None else BytesIO()
+        wb = xlsx_stream.StreamingWorkbook(out)
 
         FLOAT_DISPLAY_FORMAT = '0.##'
         INTEGER_DISPLAY_FORMAT = '0'
@@ -32815,7 +33917,7 @@ class Database:
 
             ws.column_dimensions['A'].width = 24
             for i in range(2, len(headers) + 1):
-                col = ws.cell(1, i).column_letter
+                col = get_column_letter(i)
                 ws.column_dimensions[col].width = 12
 
         def build_work_time_sheet():
@@ -32905,7 +34007,7 @@ class Database:
 
             ws.column_dimensions['A'].width = 24
             for i in range(2, len(headers) + 1):
-                col = ws.cell(1, i).column_letter
+                col = get_column_letter(i)
                 ws.column_dimensions[col].width = 14
 
         def build_calls_sheet():
@@ -33333,7 +34435,7 @@ class Database:
             if include_supervisor:
                 ws_f.column_dimensions['B'].width = 22
             for i in range(2, len(headers) + 1):
-                col = ws_f.cell(1, i).column_letter
+                col = get_column_letter(i)
                 if i == rate_col:
                     ws_f.column_dimensions[col].width = 12
                 elif day_start_col <= i < day_start_col + len(days):
@@ -33682,7 +34784,7 @@ class Database:
             if include_supervisor:
                 ws_b.column_dimensions['B'].width = 22
             for i in range(2, len(headers) + 1):
-                col = ws_b.cell(1, i).column_letter
+                col = get_column_letter(i)
                 if i == rate_col:
                     ws_b.column_dimensions[col].width = 12
                 elif day_start_col <= i < day_start_col + len(days):
@@ -33779,7 +34881,7 @@ class Database:
         # Настройка ширины колонок для вкладки Тренинги
         ws_t.column_dimensions['A'].width = 24
         for i in range(2, 3 + len(days)):
-            col = ws_t.cell(1, i).column_letter
+            col = get_column_letter(i)
             ws_t.column_dimensions[col].width = 14
 
         ws_tech = wb.create_sheet(title='Тех. сбои'[:31])
@@ -33833,7 +34935,7 @@ class Database:
 
         ws_tech.column_dimensions['A'].width = 24
         for i in range(2, 3 + len(days)):
-            col = ws_tech.cell(1, i).column_letter
+            col = get_column_letter(i)
             ws_tech.column_dimensions[col].width = 14
 
         ws_offline = wb.create_sheet(title='Офлайн активность'[:31])
@@ -33887,16 +34989,15 @@ class Database:
 
         ws_offline.column_dimensions['A'].width = 24
         for i in range(2, 3 + len(days)):
-            col = ws_offline.cell(1, i).column_letter
+            col = get_column_letter(i)
             ws_offline.column_dimensions[col].width = 14
 
-        out = BytesIO()
-        wb.save(out)
-        out.seek(0)
-        content = out.getvalue()
+        wb.close()
         if filename is None:
             filename = f"report_{month}.xlsx"
-        return filename, content
+        if output is not None:
+            return filename, None
+        return filename, out.getvalue()
 
     def generate_excel_report_all_operators_from_view(self,
         operators: List[Dict[str, Any]],
@@ -33904,11 +35005,12 @@ class Database:
         technical_issues_map: Dict[int, Dict[int, List[Dict[str, Any]]]],
         month: str,  # 'YYYY-MM'
         offline_activities_map: Dict[int, Dict[int, List[Dict[str, Any]]]] = None,
-        filename: str = None
-        ) -> Tuple[str, bytes]:
+        filename: str = None,
+        output=None
+        ) -> Tuple[str, Optional[bytes]]:
         """
         Быстрая версия: дополняет операторов supervisor_name и вызывает
-        generate_excel_report_from_view(include_supervisor=True).
+        generate_excel_report_from_view(include_supervisor=True). output — как там.
         """
         # operators может быть {"operators": [...]} или список
         ops = operators["operators"] if isinstance(operators, dict) and "operators" in operators else operators
@@ -33939,7 +35041,8 @@ class Database:
             month,
             offline_activities_map=offline_activities_map,
             filename=filename,
-            include_supervisor=True
+            include_supervisor=True,
+            output=output
         )
 
     def _normalize_break_durations_list(self, value):
@@ -34854,6 +35957,7 @@ class Database:
                     (end_date, int(group_id)),
                 )
             self._set_operators_supervisor_tx(cursor, orphaned, None)
+            self._refresh_operator_month_rollups_tx(cursor, operator_ids=orphaned)
         return self.get_group(group_id)
 
     def reuse_archived_group(self, group_id):
@@ -35064,6 +36168,7 @@ class Database:
             # работать: дни до start_date остались бы без группы и не попали бы в
             # «Учёт часов». Подбираем их сразу, а не до следующего рестарта.
             self._stamp_orphan_group_ids_tx(cursor, operator_id)
+            self._refresh_operator_month_rollups_tx(cursor, operator_ids=[operator_id])
 
     def remove_operator_from_group(self, group_id, operator_id, end_date=None):
         with self._get_cursor() as cursor:
@@ -35088,6 +36193,7 @@ class Database:
             row = cursor.fetchone()
             new_sv = self._group_active_supervisor_id_tx(cursor, row[0]) if row else None
             self._set_operators_supervisor_tx(cursor, [operator_id], new_sv)
+            self._refresh_operator_month_rollups_tx(cursor, operator_ids=[operator_id])
 
     def add_supervisor_to_group(self, group_id, supervisor_id, start_date=None, assigned_by=None):
         with self._get_cursor() as cursor:
@@ -35195,6 +36301,8 @@ class Database:
             months = [m[0] for m in (cursor.fetchall() or [])]
             for m in months:
                 self._aggregate_month_from_daily_tx(cursor, operator_id, m)
+            # Членства сдвинулись и в месяцах без часов — их свёртку тоже догоняем.
+            self._refresh_operator_month_rollups_tx(cursor, operator_ids=[operator_id])
         return {
             'operator_id': operator_id,
             'before_group_id': before_group_id,
@@ -35354,6 +36462,7 @@ class Database:
                 )
                 for m in months:
                     self._aggregate_month_from_daily_tx(cursor, member_id, m)
+                self._refresh_operator_month_rollups_tx(cursor, operator_ids=[member_id])
             else:
                 self._sync_group_operators_supervisor_tx(cursor, group_id)
         return {
@@ -37956,6 +39065,7 @@ class Database:
             # после свопа constraint на (group_id, operator_id, month).
             self._get_operator_group_id_tx(cursor, operator_id, end)
         ))
+        self._refresh_operator_month_rollups_tx(cursor, operator_ids=[operator_id], months=[month])
 
         return {
             "calculation_model_code": calculation_model_code,
@@ -38440,6 +39550,135 @@ class Database:
         with self._get_cursor() as cursor:
             return self._freeze_month_to_snapshots_tx(cursor, month)
 
+    def _ensure_operator_month_rollup_tx(self, cursor, month):
+        """Собрать свёртку «оператор × месяц» за месяц, если её ещё нет.
+
+        Сборка — один set-based пересчёт по всем пользователям, по цене ровно
+        одной старой загрузки «Учёта часов». Параллельный читатель того же
+        месяца ждёт на уникальном ключе operator_month_rollup_months, пока
+        первый не закоммитит, и читает уже собранное. True — собрали сейчас.
+        """
+        start = datetime.strptime(str(month), '%Y-%m').date()
+        cursor.execute("""
+            INSERT INTO operator_month_rollup_months (month, start_day, end_day)
+            VALUES (%s, %s, (%s::date + INTERVAL '1 month' - INTERVAL '1 day')::date)
+            ON CONFLICT (month) DO NOTHING
+            RETURNING month
+        """, (month, start, start))
+        if cursor.fetchone() is None:
+            return False
+        self._refresh_operator_month_rollups_tx(cursor, months=[month])
+        return True
+
+    def _refresh_operator_month_rollups_tx(self, cursor, operator_ids=None, months=None, from_month=None):
+        """Пересчитать строки свёртки по операторам/месяцам в текущей транзакции.
+
+        Трогает только уже собранные месяцы: несобранный месяц соберётся целиком
+        при первом чтении. Зовётся с записей, которые меняют входы свёртки:
+        daily_hours (_aggregate_month_from_daily_tx, вставка дня, импорты),
+        членства в группах и помесячная ставка (update_user). Пути записи без
+        хука (ручной SQL, удаление дней) ловит check_operator_month_rollups.
+        """
+        if operator_ids is not None:
+            operator_ids = sorted({int(op_id) for op_id in operator_ids if op_id is not None})
+            if not operator_ids:
+                return
+        if months is not None:
+            months = sorted({str(m) for m in months if m})
+            if not months:
+                return
+        cursor.execute("""
+            INSERT INTO operator_month_rollups (
+                operator_id, month, has_daily_hours, has_membership, effective_rate, refreshed_at
+            )
+            SELECT src.operator_id, src.month, src.has_daily_hours, src.has_membership,
+                   src.effective_rate, CURRENT_TIMESTAMP
+            FROM (""" + OPERATOR_MONTH_ROLLUP_RECOMPUTE_SQL + """) src
+            ON CONFLICT (month, operator_id) DO UPDATE SET
+                has_daily_hours = EXCLUDED.has_daily_hours,
+                has_membership = EXCLUDED.has_membership,
+                effective_rate = EXCLUDED.effective_rate,
+                refreshed_at = EXCLUDED.refreshed_at
+        """, {'months': months, 'from_month': from_month, 'operator_ids': operator_ids})
+
+    def _reset_operator_month_rollups_tx(self, cursor):
+        """Выбросить все собранные месяцы (строки уходят каскадом).
+
+        Для массовых миграций членств/ставок: дешевле пересобрать месяц при
+        следующем чтении, чем догонять каждую строку.
+        """
+        cursor.execute("DELETE FROM operator_month_rollup_months")
+
+    def check_operator_month_rollups(self, month=None, repair=False, sample_limit=200):
+        """Сверить свёртку «оператор × месяц» с пересчётом с нуля.
+
+        month=None — все собранные месяцы. Расхождение — строка, где видимость
+        (has_daily_hours / has_membership) или ставка не совпадают с пересчётом.
+        Отсутствующая строка расхождением считается, только если оператор в
+        месяце виден: иначе чтение и так уходит в прежний подзапрос ставки.
+        repair=True пересчитывает расходящиеся строки в той же транзакции.
+        """
+        months = [str(month)] if month else None
+        with self._get_cursor() as cursor:
+            cursor.execute(
+                "SELECT month FROM operator_month_rollup_months"
+                " WHERE %(months)s::text[] IS NULL OR month = ANY(%(months)s::text[])"
+                " ORDER BY month",
+                {'months': months},
+            )
+            checked_months = [row[0] for row in cursor.fetchall() or []]
+            cursor.execute("""
+                SELECT src.month, src.operator_id,
+                       r.operator_id IS NOT NULL AS stored,
+                       r.has_daily_hours, src.has_daily_hours,
+                       r.has_membership, src.has_membership,
+                       r.effective_rate, src.effective_rate
+                FROM (""" + OPERATOR_MONTH_ROLLUP_RECOMPUTE_SQL + """) src
+                LEFT JOIN operator_month_rollups r
+                  ON r.month = src.month AND r.operator_id = src.operator_id
+                WHERE COALESCE(r.has_daily_hours, FALSE) IS DISTINCT FROM src.has_daily_hours
+                   OR COALESCE(r.has_membership, FALSE) IS DISTINCT FROM src.has_membership
+                   OR (r.operator_id IS NOT NULL AND r.effective_rate IS DISTINCT FROM src.effective_rate)
+                ORDER BY src.month, src.operator_id
+            """, {'months': months, 'from_month': None, 'operator_ids': None})
+            rows = cursor.fetchall() or []
+
+            mismatches = []
+            for (row_month, operator_id, stored, has_daily, expected_daily,
+                 has_membership, expected_membership, rate, expected_rate) in rows:
+                mismatches.append({
+                    "month": row_month,
+                    "operator_id": int(operator_id),
+                    "stored": bool(stored),
+                    "has_daily_hours": [has_daily, bool(expected_daily)],
+                    "has_membership": [has_membership, bool(expected_membership)],
+                    "effective_rate": [
+                        float(rate) if rate is not None else None,
+                        float(expected_rate) if expected_rate is not None else None,
+                    ],
+                })
+
+            if repair and mismatches:
+                by_month = {}
+                for item in mismatches:
+                    by_month.setdefault(item["month"], set()).add(item["operator_id"])
+                for row_month, operator_ids in by_month.items():
+                    self._refresh_operator_month_rollups_tx(
+                        cursor, operator_ids=operator_ids, months=[row_month]
+                    )
+
+        if mismatches:
+            logging.warning(
+                "operator_month_rollups: %s расхождений в %s (repair=%s)",
+                len(mismatches), sorted({item["month"] for item in mismatches}), bool(repair),
+            )
+        return {
+            "months": checked_months,
+            "mismatch_count": len(mismatches),
+            "mismatches": mismatches[:max(0, int(sample_limit))],
+            "repaired": bool(repair and mismatches),
+        }
+
     def _month_snapshot_exists_tx(self, cursor, month):
         """Есть ли уже замороженный снимок за месяц (хотя бы одна строка с frozen_at)."""
         cursor.execute(
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""Фоновые выгрузки: очередь в PostgreSQL, свой пул воркеров, чекпоинты по дням.
+
+Длинные выгрузки (Chat2Desk за период, построчный биллинг Oktell, отчёт
+«Учёта часов» за месяц) шли синхронно в нити waitress: запрос держал нить и
+соединение минутами, рвался по channel_timeout, а период Chat2Desk пришлось
+ограничить неделей. Здесь та же работа идёт задачей.
+
+ЗАДАЧА. Строка export_jobs: вид (kind), параметры, уже проверенные ручкой
+постановки (права смотрятся ОДИН раз — при постановке), статус
+queued → running → done | failed и прогресс «сделано из». Очередь живёт в
+базе, поэтому переживает рестарт; забирает задачу воркер через
+FOR UPDATE SKIP LOCKED, так что два воркера одну задачу не возьмут.
+
+ЧЕКПОИНТЫ. Вид режет работу на единицы (обычно — сутки периода). Результат
+каждой единицы сразу пишется в export_job_chunks, и задача, прерванная
+рестартом или ошибкой источника, при следующем заходе досчитывает только
+недостающие сутки. Воркер, пока держит задачу, обновляет heartbeat; задача с
+протухшим heartbeat считается брошенной и снова выдаётся (не больше
+max_attempts раз).
+
+РЕЗУЛЬТАТ. Файл собирается во временный файл и уходит в хранилище
+(в приложении — GCS) загрузчиком, который передают воркерам; клиент получает
+ссылку на скачивание. Прогресс клиент смотрит SSE: воркер после каждой
+единицы дёргает notify(), ручка событий ждёт сигнала через wait_for_signal().
+
+Модуль не импортирует database и bot_schedule2: виды регистрирует
+приложение, базу и загрузчик передаёт в ExportJobWorkers.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pg_pool_metrics
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+TERMINAL_STATUSES = (STATUS_DONE, STATUS_FAILED)
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# До этого размера собранный файл живёт в памяти, дальше — на диске.
+SPOOL_BYTES = 4 * 1024 * 1024
+
+
+class ExportKind:
+    """Вид выгрузки.
+
+    plan(params) -> список ключей единиц (строки; порядок — порядок сборки).
+    prepare(params) -> контекст, общий для единиц одного захода (справочники
+        из базы и т.п.); зовётся в нити воркера, Flask-контекста там нет.
+    run_unit(params, unit, context) -> JSON-совместимый результат единицы.
+    build(params, chunks, output, context) -> имя файла; chunks — список
+        результатов единиц в порядке plan, output — file-like для записи.
+
+    Вид без единиц (plan возвращает []) просто собирает файл в build —
+    так устроен отчёт «Учёта часов»: у него нечего чекпоинтить по дням.
+    """
+
+    def __init__(self, name, *, build, plan=None, run_unit=None, prepare=None,
+                 unit_workers=1, content_type=XLSX_CONTENT_TYPE):
+        self.name = str(name)
+        self.build = build
+        self.plan = plan or (lambda params: [])
+        self.run_unit = run_unit
+        self.prepare = prepare
+        self.unit_workers = max(1, int(unit_workers or 1))
+        self.content_type = content_type
+
+
+_kinds_lock = threading.Lock()
+_kinds = {}
+
+
+def register(kind):
+    with _kinds_lock:
+        _kinds[kind.name] = kind
+    return kind
+
+
+def get_kind(name):
+    with _kinds_lock:
+        return _kinds.get(str(name or ''))
+
+
+# Сигнал прогресса для SSE: тот же приём, что у событий аукциона смен —
+# счётчик под Condition, ручка ждёт, пока он не уйдёт вперёд.
+_signal_condition = threading.Condition()
+_signal_id = 0
+
+
+def notify():
+    global _signal_id
+    with _signal_condition:
+        _signal_id += 1
+        _signal_condition.notify_all()
+
+
+def current_signal():
+    with _signal_condition:
+        return _signal_id
+
+
+def wait_for_signal(last_seen, timeout_seconds):
+    timeout_seconds = max(0.1, float(timeout_seconds or 0.1))
+    with _signal_condition:
+        if _signal_id <= last_seen:
+            _signal_condition.wait(timeout=timeout_seconds)
+        return _signal_id
+
+
+class ExportJobWorkers:
+    """Пул воркеров очереди выгрузок — отдельные нити, не нити waitress.
+
+    db — объект с методами claim_export_job / get_export_job_chunks /
+    save_export_job_chunk / touch_export_job / finish_export_job /
+    fail_export_job (см. Database). upload(job, file_name, fileobj,
+    content_type) -> (bucket, blob_path) кладёт готовый файл в хранилище.
+    Упавшая задача возвращается в очередь с паузой retry_seconds, удваивающейся
+    с каждой попыткой (не больше retry_max_seconds): источник, лежащий минуту,
+    не съедает все попытки за секунды.
+    """
+
+    def __init__(self, db, upload, *, workers=2, poll_seconds=5.0, stale_seconds=600.0,
+                 max_attempts=3, retry_seconds=30.0, retry_max_seconds=900.0, name='export-job'):
+        self.db = db
+        self.upload = upload
+        self.workers = max(1, int(workers))
+        self.poll_seconds = max(0.5, float(poll_seconds))
+        self.stale_seconds = max(30.0, float(stale_seconds))
+        self.max_attempts = max(1, int(max_attempts))
+        self.retry_seconds = max(0.0, float(retry_seconds))
+        self.retry_max_seconds = max(self.retry_seconds, float(retry_max_seconds))
+        self.name = name
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        with self._start_lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._loop, args=(f"{self.name}-{index}",),
+                    name=f"{self.name}-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def wake(self):
+        """Новая задача в очереди: не ждать очередного опроса."""
+        self._wake.set()
+
+    def retry_delay(self, attempts):
+        """Пауза перед следующим заходом задачи, у которой за спиной attempts попыток."""
+        delay = self.retry_seconds * 2 ** max(0, int(attempts or 0) - 1)
+        return min(self.retry_max_seconds, delay)
+
+    def _loop(self, worker_name):
+        while True:
+            try:
+                if self.run_once(worker_name):
+                    continue
+            except Exception:
+                logging.exception("Фоновые выгрузки: воркер %s не смог взять задачу", worker_name)
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def run_once(self, worker_name):
+        """Взять и выполнить одну задачу. False — очередь пуста."""
+        job = self.db.claim_export_job(worker_name, self.stale_seconds, self.max_attempts)
+        if not job:
+            return False
+        with pg_pool_metrics.consumer(f"job:export-{job['kind']}"):
+            self._run(job)
+        return True
+
+    def _run(self, job):
+        job_id = job['id']
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job_id, stop),
+            name=f"{self.name}-heartbeat", daemon=True)
+        heartbeat.start()
+        notify()
+        try:
+            kind = get_kind(job['kind'])
+            if kind is None:
+                raise RuntimeError(f"неизвестный вид выгрузки: {job['kind']}")
+            params = job.get('params') or {}
+            context = kind.prepare(params) if kind.prepare else None
+            chunks = self._run_units(job_id, kind, params, context)
+            with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as output:
+                file_name = kind.build(params, chunks, output, context)
+                size = output.seek(0, os.SEEK_END)
+                output.seek(0)
+                if not file_name or not size:
+                    raise RuntimeError("выгрузка собрала пустой файл")
+                bucket, blob_path = self.upload(job, file_name, output, kind.content_type)
+            self.db.finish_export_job(job_id, file_name, bucket, blob_path, size)
+            logging.info("Фоновые выгрузки: задача %s (%s) готова, %s байт", job_id, kind.name, size)
+        except Exception as exc:
+            retry = int(job.get('attempts') or 0) < self.max_attempts
+            logging.exception("Фоновые выгрузки: задача %s (%s) упала, повтор=%s",
+                              job_id, job.get('kind'), retry)
+            self.db.fail_export_job(
+                job_id, str(exc)[:500], retry=retry,
+                retry_delay_seconds=self.retry_delay(job.get('attempts')) if retry else 0)
+        finally:
+            stop.set()
+            notify()
+
+    def _run_units(self, job_id, kind, params, context):
+        units = [str(unit) for unit in kind.plan(params)]
+        done = self.db.get_export_job_chunks(job_id) if units else {}
+        pending = [unit for unit in units if unit not in done]
+        total = len(units)
+        if units and len(pending) < total:
+            logging.info("Фоновые выгрузки: задача %s продолжает с чекпоинта (%s из %s)",
+                         job_id, total - len(pending), total)
+        if pending:
+            def _one(unit):
+                return unit, kind.run_unit(params, unit, context)
+
+            if kind.unit_workers > 1 and len(pending) > 1:
+                workers = min(kind.unit_workers, len(pending))
+                failure = None
+                with ThreadPoolExecutor(max_workers=workers,
+                                        thread_name_prefix=f"{self.name}-unit") as pool:
+                    labelled = pg_pool_metrics.bind(pg_pool_metrics.current_consumer(), _one)
+                    futures = [pool.submit(labelled, unit) for unit in pending]
+                    # Каждая удачная единица уходит в чекпоинт, даже если соседняя упала:
+                    # повтор задачи досчитает только упавшие сутки.
+                    for future in as_completed(futures):
+                        try:
+                            unit, chunk = future.result()
+                        except Exception as exc:
+                            failure = failure or exc
+                            continue
+                        done[unit] = chunk
+                        self.db.save_export_job_chunk(job_id, unit, chunk, len(done), total)
+                        notify()
+                if failure is not None:
+                    raise failure
+            else:
+                for unit in pending:
+                    unit, chunk = _one(unit)
+                    done[unit] = chunk
+                    self.db.save_export_job_chunk(job_id, unit, chunk, len(done), total)
+                    notify()
+        return [done[unit] for unit in units]
+
+    def _heartbeat(self, job_id, stop):
+        # Долгая единица (или сборка файла) не должна выглядеть брошенной.
+        interval = self.stale_seconds / 3.0
+        while not stop.wait(interval):
+            try:
+                self.db.touch_export_job(job_id)
+            except Exception:
+                logging.warning("Фоновые выгрузки: heartbeat задачи %s не записался", job_id)
@@ -51,6 +51,7 @@ from openpyxl import Workbook
 from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
 from openpyxl.utils import get_column_letter
 
+import http_clients
 import reg_contest
 
 log = logging.getLogger(__name__)
@@ -103,7 +104,7 @@ class RegionCallStatsClient:
         self.token = token
         self.timeout = timeout
         self.retries = max(int(retries or 1), 1)
-        self.session = requests.Session()
+        self.session = http_clients.session("crm")
 
     @classmethod
     def from_config(cls, config=None, timeout=HTTP_TIMEOUT, retries=MAX_RETRIES):
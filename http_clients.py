@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""Общий HTTP-слой внешних интеграций: пул соединений, темп, повторы, метрики.
+
+Каждая интеграция (amoCRM, ChatApp, Binotel, Chat2Desk, CRM, TEZ APP, прокси
+Oktell, Telegram, LLM-провайдеры вики) заводила свой requests.Session, свой
+разбор обрыва соединения и своё «подождать и повторить». Сессии жили столько
+же, сколько объект клиента: AmoClient создаётся на каждый синк, и каждый синк
+заново платил TLS-рукопожатием; Binotel держал собственный замок на процесс;
+а на вопрос «какая интеграция тормозит и как часто нас ограничивают» ответа не
+было вовсе. Модуль собирает это в одно место.
+
+ПУЛ. Адаптер (и с ним пул urllib3) один на интеграцию и на процесс, внутри —
+отдельный пул на каждый хост. session(name) выдаёт клиенту СВОЙ Session
+(заголовки и куки у клиентов разные: у amoCRM вход по логину — это куки), но
+смонтированный на общий адаптер, поэтому соединения переживают объект клиента.
+close() клиентской сессии общий пул не закрывает.
+
+ТЕМП. rate_per_second — ведро токенов на интеграцию (ChatApp: 50 запросов в
+секунду на IP; Binotel: не чаще раза в секунду). Общее для всех нитей и всех
+клиентов процесса — ограничение у сервиса тоже общее.
+
+ОГРАНИЧЕНИЕ СЕРВИСОМ. 429 (и 503 с Retry-After) и интеграционные признаки вроде
+Binotel «Requests are too frequent ... after N sec» (функция throttled(response)
+→ секунды или None) ставят хост на паузу для всей интеграции: следующий запрос
+любой нити подождёт, а не получит тот же отказ. Повторяет отказанный запрос
+по-прежнему клиент — только он знает, что в его ответе значит «ошибка». Остаток
+квоты из X-RateLimit-Remaining (Chat2Desk, amoCRM) виден в метриках.
+
+ПОВТОР. Сам слой повторяет только обрыв УЖЕ установленного соединения
+(dropped_connection: протух keep-alive из пула) и только для идемпотентных
+методов. Таймауты и отказ в соединении — «сервис недоступен», их не повторяем.
+
+HTTP/2. requests умеет только HTTP/1.1. Клиенты на httpx (LLM-провайдеры)
+получают httpx_client(name): HTTP/2 включается, если установлен пакет h2, иначе
+остаётся HTTP/1.1 — тот же пул и те же метрики.
+
+Метрики — snapshot()/reset_stats(), их отдаёт /api/admin/http_clients/stats.
+Запрос, сделанный из джобы планировщика, засчитывается и её прогону в журнале
+(scheduler_pools.count_external_call).
+Модуль не импортирует database: он тестируется без базы.
+"""
+
+import collections
+import importlib.util
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from http.client import RemoteDisconnected
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import scheduler_pools
+
+# Потолок паузы по подсказке сервиса: кривой Retry-After не должен усыпить
+# интеграцию на час.
+MAX_PAUSE_SECONDS = 60.0
+# Сколько последних задержек держим на интеграцию для перцентилей.
+LATENCY_WINDOW = 512
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+# Повторяем ТОЛЬКО обрыв уже установленного соединения: сервер закрыл сокет, не
+# начав отвечать, — значит запрос не выполнялся, и повтор безопасен. Таймауты и
+# отказ в соединении сюда не входят: это «сервис недоступен», и повтор тут только
+# добавит нагрузки.
+DROPPED_CONNECTION_ERRORS = (
+    RemoteDisconnected, ConnectionResetError, ConnectionAbortedError, BrokenPipeError)
+
+
+def dropped_connection(exc):
+    """Оборвалось ли соединение уже ПОСЛЕ установки.
+
+    Причину ищем по всей цепочке, а не по тексту сообщения: requests заворачивает
+    urllib3, urllib3 — http.client, и наружу выходит одинаковый на вид
+    `ConnectionError('Connection aborted.', ...)`.
+    """
+    stack = [exc]
+    seen = set()
+    while stack:
+        current = stack.pop()
+        if not isinstance(current, BaseException) or id(current) in seen:
+            continue
+        seen.add(id(current))
+        if isinstance(current, DROPPED_CONNECTION_ERRORS):
+            return True
+        stack.append(current.__cause__)
+        stack.append(current.__context__)
+        stack.extend(getattr(current, 'args', ()) or ())
+    return False
+
+
+def retry_after_seconds(response, now=None):
+    """Retry-After в секундах (число или HTTP-дата); None, если заголовка нет."""
+    raw = str((getattr(response, 'headers', None) or {}).get('Retry-After') or '').strip()
+    if not raw:
+        return None
+    try:
+        return max(0.0, float(raw))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(raw)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, moment.timestamp() - (time.time() if now is None else now))
+
+
+def _quota_remaining(response):
+    raw = (getattr(response, 'headers', None) or {}).get('X-RateLimit-Remaining')
+    try:
+        return int(str(raw).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _default_throttled(response):
+    """Пауза по стандартным признакам: 429 всегда, 503 — только с Retry-After."""
+    status = getattr(response, 'status_code', None)
+    wait = retry_after_seconds(response)
+    if status == 429:
+        return 1.0 if wait is None else wait
+    if status == 503 and wait is not None:
+        return wait
+    return None
+
+
+class Pacer:
+    """Ведро токенов интеграции плюс паузы, объявленные хостами. Потокобезопасен.
+
+    Пауза — по хосту: у LLM-провайдеров вики одна интеграция на несколько
+    сервисов, и 429 от одного не должен задерживать переход к следующему.
+    """
+
+    def __init__(self, rate_per_second=None, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate_per_second) if rate_per_second else None
+        self.burst = max(1.0, float(burst if burst is not None else (self.rate or 1.0)))
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = clock()
+        self._paused_until = {}
+
+    def acquire(self, host=None):
+        """Дождаться права на запрос к host; возвращает, сколько секунд ждали."""
+        waited = 0.0
+        while True:
+            reserved = False
+            with self._lock:
+                now = self._clock()
+                paused_until = self._paused_until.get(host, 0.0)
+                if now < paused_until:
+                    wait = paused_until - now
+                elif self.rate is None:
+                    return waited
+                else:
+                    # Токен берём сразу, в долг: ждущие нити выстраиваются в
+                    # очередь по своим долям, а не проверяют ведро наперегонки.
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    self._tokens -= 1.0
+                    if self._tokens >= 0.0:
+                        return waited
+                    wait = -self._tokens / self.rate
+                    reserved = True
+            self._sleep(wait)
+            waited += wait
+            if reserved:
+                return waited
+
+    def pause(self, seconds, host=None):
+        """Никаких запросов к host ближайшие seconds (не короче уже объявленной паузы)."""
+        seconds = min(max(0.0, float(seconds)), MAX_PAUSE_SECONDS)
+        with self._lock:
+            now = self._clock()
+            self._paused_until = {key: until for key, until in self._paused_until.items()
+                                  if until > now}
+            self._paused_until[host] = max(self._paused_until.get(host, 0.0), now + seconds)
+        return seconds
+
+
+def _blank_stats():
+    return {
+        'requests': 0,
+        'errors': 0,
+        'retries': 0,
+        'throttled': 0,
+        'status': collections.Counter(),
+        'latency_total': 0.0,
+        'latency_max': 0.0,
+        'latencies': collections.deque(maxlen=LATENCY_WINDOW),
+        'paced_seconds': 0.0,
+        'quota_remaining': None,
+        'last_error': None,
+    }
+
+
+class _Integration:
+    """Общее на процесс для одной интеграции: адаптер, темп, политика, счётчики."""
+
+    def __init__(self, name, rate_per_second, burst, pool_connections, pool_maxsize,
+                 retries, throttled):
+        self.name = name
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.pacer = Pacer(rate_per_second, burst)
+        self.retries = max(0, int(retries))
+        self.throttled = throttled
+        self.lock = threading.Lock()
+        self.stats = _blank_stats()
+
+    def observe(self, elapsed, status=None, error=None, retried=False):
+        scheduler_pools.count_external_call()
+        with self.lock:
+            stats = self.stats
+            stats['requests'] += 1
+            stats['latency_total'] += elapsed
+            stats['latency_max'] = max(stats['latency_max'], elapsed)
+            stats['latencies'].append(elapsed)
+            if retried:
+                stats['retries'] += 1
+            if error is not None:
+                stats['errors'] += 1
+                stats['last_error'] = '%s: %s' % (type(error).__name__, str(error)[:200])
+            elif status is not None:
+                stats['status']['%dxx' % (int(status) // 100)] += 1
+
+    def note(self, paced=0.0, throttled=False, quota_remaining=None):
+        with self.lock:
+            self.stats['paced_seconds'] += paced
+            if throttled:
+                self.stats['throttled'] += 1
+            if quota_remaining is not None:
+                self.stats['quota_remaining'] = quota_remaining
+
+    def after_response(self, response, host):
+        """Объявленное сервисом ограничение ставит хост на паузу для всех нитей."""
+        wait = _default_throttled(response)
+        if wait is None and self.throttled is not None:
+            try:
+                wait = self.throttled(response)
+            except Exception:  # noqa: BLE001 — кривой ответ разбирает клиент, не мы
+                wait = None
+        if wait is not None:
+            paused = self.pacer.pause(wait, host)
+            logging.info('%s: %s ограничил частоту, пауза %.1f с', self.name, host, paused)
+        self.note(throttled=wait is not None, quota_remaining=_quota_remaining(response))
+
+
+_registry_lock = threading.Lock()
+_integrations = {}
+
+
+def integration(name, *, rate_per_second=None, burst=None, pool_connections=4,
+                pool_maxsize=8, retries=1, throttled=None):
+    """Общие на процесс настройки интеграции; первый вызов их и задаёт."""
+    with _registry_lock:
+        found = _integrations.get(name)
+        if found is None:
+            found = _Integration(name, rate_per_second, burst, pool_connections,
+                                 pool_maxsize, retries, throttled)
+            _integrations[name] = found
+        return found
+
+
+class IntegrationSession(requests.Session):
+    """Session клиента на общем адаптере интеграции: темп, пауза, повтор, метрики."""
+
+    def __init__(self, shared):
+        super().__init__()
+        self._integration = shared
+        self.mount('http://', shared.adapter)
+        self.mount('https://', shared.adapter)
+
+    @property
+    def integration_name(self):
+        return self._integration.name
+
+    def request(self, method, url, *args, **kwargs):
+        shared = self._integration
+        attempts = 1 + (shared.retries if str(method).upper() in IDEMPOTENT_METHODS else 0)
+        host = _host(url)
+        for attempt in range(1, attempts + 1):
+            shared.note(paced=shared.pacer.acquire(host))
+            started = time.monotonic()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except requests.RequestException as exc:
+                shared.observe(time.monotonic() - started, error=exc, retried=attempt > 1)
+                if attempt >= attempts or not dropped_connection(exc):
+                    raise
+                logging.warning('%s: соединение из пула оборвалось (%s), повтор %s',
+                                shared.name, exc, url)
+                continue
+            shared.observe(time.monotonic() - started, status=response.status_code,
+                           retried=attempt > 1)
+            shared.after_response(response, host)
+            return response
+
+    def close(self):
+        # Адаптер общий для всех клиентов интеграции: закрыть его — оборвать
+        # соединения соседям. Сессия просто перестаёт им пользоваться.
+        self.adapters.clear()
+
+
+def session(name, **options):
+    """Новый Session клиента интеграции name на её общем пуле (options — см. integration)."""
+    return IntegrationSession(integration(name, **options))
+
+
+def _host(url):
+    return urlsplit(str(url)).hostname
+
+
+def http2_available():
+    return importlib.util.find_spec('h2') is not None
+
+
+def httpx_client(name, *, timeout, max_keepalive_connections=8, max_connections=16, **options):
+    """httpx.Client на общем учёте интеграции: HTTP/2, если стоит h2, и те же метрики."""
+    import httpx
+
+    shared = integration(name, **options)
+
+    class _ObservedTransport(httpx.HTTPTransport):
+        def handle_request(self, request):
+            host = request.url.host
+            shared.note(paced=shared.pacer.acquire(host))
+            started = time.monotonic()
+            try:
+                response = super().handle_request(request)
+            except httpx.HTTPError as exc:
+                shared.observe(time.monotonic() - started, error=exc)
+                raise
+            shared.observe(time.monotonic() - started, status=response.status_code)
+            shared.after_response(response, host)
+            return response
+
+    limits = httpx.Limits(max_keepalive_connections=max_keepalive_connections,
+                          max_connections=max_connections)
+    transport = _ObservedTransport(http2=http2_available(), limits=limits)
+    return httpx.Client(timeout=timeout, transport=transport)
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def snapshot():
+    """Сводка по интеграциям: запросы, ошибки, повторы, паузы, задержки (мс)."""
+    out = {}
+    with _registry_lock:
+        items = list(_integrations.items())
+    for name, shared in sorted(items):
+        with shared.lock:
+            stats = shared.stats
+            latencies = list(stats['latencies'])
+            count = stats['requests']
+            out[name] = {
+                'requests': count,
+                'errors': stats['errors'],
+                'retries': stats['retries'],
+                'throttled': stats['throttled'],
+                'status': dict(stats['status']),
+                'latency_avg_ms': round(stats['latency_total'] / count * 1000, 1) if count else None,
+                'latency_p50_ms': _ms(_percentile(latencies, 0.5)),
+                'latency_p95_ms': _ms(_percentile(latencies, 0.95)),
+                'latency_max_ms': _ms(stats['latency_max']) if count else None,
+                'paced_seconds': round(stats['paced_seconds'], 3),
+                'quota_remaining': stats['quota_remaining'],
+                'last_error': stats['last_error'],
+                'rate_per_second': shared.pacer.rate,
+            }
+    return {'integrations': out, 'http2_available': http2_available()}
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def reset_stats():
+    with _registry_lock:
+        items = list(_integrations.values())
+    for shared in items:
+        with shared.lock:
+            shared.stats = _blank_stats()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""Кеш сводки колокола: по пользователю и источнику, сброс — тычками триггеров.
+
+Каждый reload заставлял collect() заново считать все восемь источников и
+next_change_at, хотя триггер уже сказал, ЧТО изменилось: тычок адресный, и с
+недавних пор в нём есть имя источника ('{"u":[..],"s":"tasks"}'). Кеш хранит
+результат каждого источника отдельно и сбрасывает ровно ту пару
+(пользователь, источник), о которой сообщил триггер; широковещательный тычок
+('{"b":1,"s":"events"}') сбрасывает один источник у всех сразу — это O(1),
+счётчиком, без обхода пользователей.
+
+Гонка «посчитали → пришёл сброс → положили устаревшее» закрыта эпохами: каждая
+запись помнит эпоху, с которой её НАЧАЛИ считать, а сброс помечает свою пару
+новой эпохой. Запись, чья эпоха младше отметки сброса, недействительна, даже
+если легла в кеш позже него.
+
+Кеш верен, только пока слушатель bell_events жив: пропущенный сброс здесь уже
+не «задержка до фокуса», а устаревшая сводка. Поэтому при лежащем слушателе его
+не используют вовсе (см. routes.py), после переподключения он сбрасывается
+целиком (realtime._subscribe), а каждая запись живёт не дольше max_age — на
+случай изменений, о которых триггеры не сообщают (правка заголовка поста,
+дни рождения из карточки сотрудника). Переходы по часам снимает wake_at: в
+момент next_change_at записи пользователя выбрасываются целиком.
+"""
+
+import collections
+import threading
+import time
+
+# Сколько живёт запись без сброса. Это потолок устаревания для того, о чём
+# триггеры молчат; всё, о чём они сообщают, сбрасывается мгновенно.
+SUMMARY_MAX_AGE_SECONDS = 120
+# Потолок числа пользователей в памяти: вытесняется давно не заходивший.
+SUMMARY_MAX_USERS = 5000
+
+
+def _viewer_key(viewer):
+    """Слепок периметра зрителя: смена роли или отдела — и прежние записи чужие."""
+    return tuple(sorted((key, repr(value)) for key, value in viewer.items()))
+
+
+class SummaryCache:
+    """Результаты источников по пользователю. Потокобезопасен."""
+
+    def __init__(self, max_age_seconds=SUMMARY_MAX_AGE_SECONDS, max_users=SUMMARY_MAX_USERS,
+                 clock=time.monotonic):
+        self.max_age_seconds = float(max_age_seconds)
+        self.max_users = int(max_users)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._users = collections.OrderedDict()  # user_id -> {'viewer', 'limit', 'wake_at', 'entries'}
+        self._epoch = 0
+        # Отметки сбросов: эпоха последнего сброса пары/источника/всего.
+        # (user_id, None) — адресный тычок без имени источника (старый триггер).
+        self._user_dirty = {}
+        self._source_dirty = {}
+        self._all_dirty = 0
+        self._stats = {'hits': 0, 'misses': 0, 'addressed': 0, 'broadcast': 0, 'resets': 0}
+
+    # ── сброс ───────────────────────────────────────────────────────────────
+    def invalidate(self, targets, source=None):
+        """targets=None — всем (широковещательный), иначе набор user_id."""
+        with self._lock:
+            self._epoch += 1
+            if targets is None:
+                self._stats['broadcast'] += 1
+                if source is None:
+                    self._all_dirty = self._epoch
+                else:
+                    self._source_dirty[source] = self._epoch
+                return
+            self._stats['addressed'] += 1
+            for user_id in targets:
+                self._user_dirty[(user_id, source)] = self._epoch
+
+    def invalidate_all(self):
+        with self._lock:
+            self._epoch += 1
+            self._all_dirty = self._epoch
+            self._stats['resets'] += 1
+            self._users.clear()
+            self._user_dirty.clear()
+            self._source_dirty.clear()
+
+    # ── чтение и запись ─────────────────────────────────────────────────────
+    def lookup(self, viewer, limit):
+        """(эпоха, {ключ: значение}) — эпоху передать в store() посчитанного."""
+        user_id = viewer['user_id']
+        now = self._clock()
+        with self._lock:
+            epoch = self._epoch
+            record = self._users.get(user_id)
+            if record is None:
+                return epoch, {}
+            if (record['viewer'] != _viewer_key(viewer) or record['limit'] != limit
+                    or (record['wake_at'] is not None and now >= record['wake_at'])):
+                del self._users[user_id]
+                return epoch, {}
+            self._users.move_to_end(user_id)
+            fresh = {}
+            for key, (entry_epoch, expires_at, depends_on, value) in list(record['entries'].items()):
+                if now >= expires_at or entry_epoch < self._dirty_epoch_locked(user_id, depends_on):
+                    del record['entries'][key]
+                    continue
+                fresh[key] = value
+            return epoch, fresh
+
+    def store(self, viewer, limit, epoch, key, value, depends_on=None, wake_in=None):
+        """Положить результат, посчитанный с эпохи epoch.
+
+        depends_on — какие источники его сбрасывают (по умолчанию сам key);
+        wake_in — через сколько секунд все записи пользователя устареют сами.
+        """
+        user_id = viewer['user_id']
+        now = self._clock()
+        viewer_key = _viewer_key(viewer)
+        depends_on = tuple(depends_on or (key,))
+        with self._lock:
+            if epoch < self._dirty_epoch_locked(user_id, depends_on):
+                return False
+            record = self._users.get(user_id)
+            if record is None or record['viewer'] != viewer_key or record['limit'] != limit:
+                record = {'viewer': viewer_key, 'limit': limit, 'wake_at': None, 'entries': {}}
+                self._users[user_id] = record
+            self._users.move_to_end(user_id)
+            if wake_in is not None:
+                wake_at = now + max(0.0, float(wake_in))
+                if record['wake_at'] is None or wake_at < record['wake_at']:
+                    record['wake_at'] = wake_at
+            record['entries'][key] = (epoch, now + self.max_age_seconds, depends_on, value)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            return True
+
+    def count(self, hit):
+        with self._lock:
+            self._stats['hits' if hit else 'misses'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._stats, users=len(self._users), epoch=self._epoch)
+
+    def _dirty_epoch_locked(self, user_id, depends_on):
+        dirty = max(self._all_dirty, self._user_dirty.get((user_id, None), 0))
+        for source in depends_on:
+            dirty = max(dirty, self._source_dirty.get(source, 0),
+                        self._user_dirty.get((user_id, source), 0))
+        return dirty
@@ -16,16 +16,46 @@
 клиент просыпается ровно к названному моменту, см. sources.next_change_at.
 
 Тычки шлют триггеры на таблицах источников — см.
-database.py::_init_bell_notify_schema_tx. Payload: '{"u":[id,...]}' (адресный)
-или '{"b":1}' (широковещательный — «Ивенты» и «4 You», их периметр зритель
-выясняет сам при перечитке).
+database.py::_init_bell_notify_schema_tx. Payload: '{"u":[id,...],"s":"tasks"}'
+(адресный) или '{"b":1,"s":"events"}' (широковещательный — «Ивенты» и «4 You»,
+их периметр зритель выясняет сам при перечитке). Имя источника тычку не нужно —
+по нему слушатель сбрасывает кеш сводки (notifications/cache.py), чтобы
+перечитка пересчитала только изменившийся раздел.
+
+Режим дельт (?mode=delta у /stream). Триггер называет и строку ("r": id), и
+тычок в кольце несёт источники и строки. Поток в этом режиме сам пересчитывает
+изменившиеся источники зрителя и шлёт их готовыми (event: delta) с номером
+тычка в id:, — клиенту не нужен обратный запрос за сводкой. Номер — курсор
+возобновления: переподключившийся клиент присылает его в ?after=, и если курсор
+ещё в кольце, получает дельту за пропущенное; выпавший из кольца (или из
+другой жизни процесса) — event: reload, то есть прежнюю полную перечитку.
+Тычок без источника (старый триггер, сверка после LISTEN) — тоже reload.
+
+Несколько процессов. Каждый процесс слушает bell_events сам и держит своё
+кольцо, поэтому локальный номер тычка (seq) годится только внутри процесса:
+балансировщик отправит переподключившегося клиента в соседний процесс, где
+те же номера значат другое. Курсор в id: — сквозной номер из bell_event_seq
+("i" в payload, общий для всех процессов). Номера раздаются в порядке вызова
+nextval, а не коммита, поэтому их не сравнивают: NOTIFY все слушатели
+получают в одном порядке коммитов, и курсор ищется в кольце по членству
+(_event_index). Не нашёлся (другой процесс его ещё не получил, кольцо его
+уже вытеснило) — reload. Склейка в разных процессах закрывает окна чуть в
+разное время, поэтому возобновление отступает назад на окно склейки:
+повторно присланная дельта безвредна, пропущенная — нет.
+
+Широковещательные тычки склеиваются: пачка постов или фото за секунду даёт
+ОДНУ перечитку у каждого клиента, а не по перечитке на строку, — иначе каждая
+вставка поднимала бы всех подключённых разом. Кеш при этом сбрасывается сразу,
+задерживается только сам тычок (BROADCAST_COALESCE_SECONDS).
 
 Ёмкость. Каждый SSE-поток занимает нить waitress на всё время соединения
 (их всего WAITRESS_THREADS≈96), поэтому число потоков жёстко ограничено
 слотами: сверх лимита клиент получает 503 и остаётся на обновлении по фокусу.
 Замер 2026-08-09: активных за 5 минут — 13 человек, за 15 — 22, так что лимита
 по умолчанию хватает всем живым вкладкам с запасом; скрытые вкладки слот не
-держат — клиент рвёт соединение, уходя в фон.
+держат — клиент рвёт соединение, уходя в фон. Лимит касается только пути через
+waitress: SSE-шлюз (sse_gateway.py) раздаёт те же тычки корутинами, через
+poll_tick и одну ждущую нить на wait_for_seq.
 """
 
 import collections
@@ -35,6 +65,8 @@ import select
 import threading
 import time
 
+from .cache import SummaryCache
+
 # Имя канала продублировано в database.py (BELL_EVENTS_NOTIFY_CHANNEL и литерал
 # в теле триггера): импортировать database отсюда нельзя — модуль тестируется
 # без него. Совпадение сверяет tests/test_notifications.py.
@@ -48,52 +80,160 @@ LISTENER_RETRY_SECONDS = 2
 # каждом пробуждении, так что отстать на длину кольца практически невозможно —
 # запас на всплеск (массовое назначение опроса даёт по тычку на назначение).
 TICK_BUFFER_MAXLEN = 1000
+# Окно склейки широковещательных тычков: первый открывает окно, остальные в
+# него просто вливаются, клиенты получают один тычок в конце.
+BROADCAST_COALESCE_SECONDS = 1.0
+# Насколько назад отступает возобновление по сквозному курсору: окно склейки с
+# запасом на то, что соседний процесс получил тот же NOTIFY чуть позже.
+RESUME_REWIND_SECONDS = 2 * BROADCAST_COALESCE_SECONDS
 
 _condition = threading.Condition()
-_ticks = collections.deque(maxlen=TICK_BUFFER_MAXLEN)  # (seq, frozenset|None), None = всем
+# Тычок кольца. targets None = всем, sources None = неизвестно что (нужна
+# полная перечитка), rows — frozenset пар (источник, id); event_ids — сквозные
+# номера влитых в него NOTIFY, mark — последний сквозной номер на момент
+# тычка (курсор для id:), at — monotonic публикации.
+_Tick = collections.namedtuple('_Tick', 'seq targets sources rows event_ids mark at')
+_ticks = collections.deque(maxlen=TICK_BUFFER_MAXLEN)
 _seq = 0
+_mark = 0
+# Сквозной номер -> seq тычка, в который он влит. Чистится вместе с кольцом.
+_event_index = {}
+
+# Что накопилось для зрителя за отрезок кольца. sources=None — только полная
+# перечитка; rows — пары (источник, id строки), о которых сообщили триггеры.
+BellChanges = collections.namedtuple('BellChanges', 'sources rows')
 
 _listener_started = False
 _listener_lock = threading.Lock()
+# LISTEN оформлен и соединение живо. Только при нём кеш сводки честен.
+_listener_live = False
+# Момент (monotonic), к которому отправить склеенный широковещательный тычок,
+# и что в него уже влилось. Трогает только нить слушателя.
+_broadcast_due_at = None
+_broadcast_sources = set()
+_broadcast_rows = set()
+_broadcast_event_ids = []
+
+# Кеш сводки процесса: сбрасывается отсюда же, из разбора тычков.
+summary_cache = SummaryCache()
 
 _active_streams = 0
 _streams_lock = threading.Lock()
 
 
-def _publish(targets):
-    global _seq
+def _publish(targets, sources=None, rows=frozenset(), event_ids=()):
+    global _seq, _mark
     with _condition:
         _seq += 1
-        _ticks.append((_seq, targets))
+        event_ids = tuple(event_ids)
+        if event_ids:
+            _mark = event_ids[-1]
+        if len(_ticks) == _ticks.maxlen:
+            evicted = _ticks[0]
+            for event_id in evicted.event_ids:
+                if _event_index.get(event_id) == evicted.seq:
+                    del _event_index[event_id]
+        _ticks.append(_Tick(_seq, targets, sources, rows, event_ids, _mark, time.monotonic()))
+        for event_id in event_ids:
+            _event_index[event_id] = _seq
         _condition.notify_all()
 
 
-def _parse_payload(payload):
-    """None — широковещательный, frozenset — адресный, False — мусор (игнор)."""
+def _optional_int(value):
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_notify(payload):
+    """(адресаты, источник, id строки, сквозной номер) из payload триггера.
+
+    Адресаты: None — широковещательный, frozenset — адресный, False — мусор
+    (игнор). Остальное — None, если триггер его не назвал.
+    """
     try:
         data = json.loads(payload) if payload else {}
     except Exception:
-        return False
+        return False, None, None, None
     if not isinstance(data, dict):
-        return False
+        return False, None, None, None
+    source = data.get('s') if isinstance(data.get('s'), str) and data.get('s') else None
+    row = _optional_int(data.get('r'))
+    event_id = _optional_int(data.get('i'))
     if data.get('b'):
-        return None
+        return None, source, row, event_id
     try:
         ids = frozenset(int(item) for item in (data.get('u') or []) if item)
     except Exception:
+        return False, None, None, None
+    return (ids if ids else False), source, row, event_id
+
+
+def _parse_payload(payload):
+    """None — широковещательный, frozenset — адресный, False — мусор (игнор)."""
+    return _parse_notify(payload)[0]
+
+
+def _tick_sources(source, row):
+    """(источники, строки) тычка из разобранного payload."""
+    if source is None:
+        return None, frozenset()
+    return frozenset({source}), (frozenset({(source, row)}) if row is not None else frozenset())
+
+
+def _queue_broadcast(source=None, row=None, event_id=None, now=None):
+    """Открыть окно склейки (если ещё не открыто) и влить в него источник."""
+    global _broadcast_due_at, _broadcast_sources
+    if _broadcast_due_at is None:
+        _broadcast_due_at = (time.monotonic() if now is None else now) + BROADCAST_COALESCE_SECONDS
+    if event_id is not None:
+        _broadcast_event_ids.append(event_id)
+    if source is None:
+        _broadcast_sources = None
+    elif _broadcast_sources is not None:
+        _broadcast_sources.add(source)
+        if row is not None:
+            _broadcast_rows.add((source, row))
+
+
+def _flush_broadcast(now=None):
+    """Отправить склеенный тычок, если окно истекло. True — отправлен."""
+    global _broadcast_due_at, _broadcast_sources
+    if _broadcast_due_at is None:
+        return False
+    if (time.monotonic() if now is None else now) < _broadcast_due_at:
         return False
-    return ids if ids else False
+    sources = frozenset(_broadcast_sources) if _broadcast_sources is not None else None
+    rows = frozenset(_broadcast_rows) if sources is not None else frozenset()
+    event_ids = tuple(_broadcast_event_ids)
+    _broadcast_due_at = None
+    _broadcast_sources = set()
+    _broadcast_rows.clear()
+    del _broadcast_event_ids[:]
+    _publish(None, sources, rows, event_ids)
+    return True
 
 
 def _drain_notifies(conn):
-    """Снять накопившиеся NOTIFY с соединения и опубликовать валидные."""
+    """Снять накопившиеся NOTIFY с соединения и опубликовать валидные.
+
+    Кеш сбрасывается ДО тычка: клиент, разбуженный тычком, обязан перечитать
+    уже свежую сводку.
+    """
     got_any = False
     while conn.notifies:
         note = conn.notifies.pop(0)
         got_any = True
-        parsed = _parse_payload(note.payload)
-        if parsed is not False:
-            _publish(parsed)
+        targets, source, row, event_id = _parse_notify(note.payload)
+        if targets is False:
+            continue
+        summary_cache.invalidate(targets, source)
+        if targets is None:
+            _queue_broadcast(source, row, event_id)
+        else:
+            _publish(targets, *_tick_sources(source, row),
+                     event_ids=(event_id,) if event_id is not None else ())
     return got_any
 
 
@@ -103,11 +243,19 @@ def _subscribe(conn):
     Между падением старого соединения и успешным новым LISTEN PostgreSQL не
     хранит NOTIFY для этого процесса. Широковещательная тычка после каждого
     подключения закрывает это окно: содержимого в ней нет, клиенты просто
-    перечитают актуальное состояние обычным HTTP-запросом.
+    перечитают актуальное состояние обычным HTTP-запросом. По той же причине
+    кеш сводки сбрасывается целиком: сбросы из этого окна потеряны.
     """
+    global _listener_live, _broadcast_due_at, _broadcast_sources
     conn.set_session(autocommit=True)
     cursor = conn.cursor()
     cursor.execute('LISTEN %s' % BELL_NOTIFY_CHANNEL)
+    summary_cache.invalidate_all()
+    _listener_live = True
+    _broadcast_due_at = None
+    _broadcast_sources = set()
+    _broadcast_rows.clear()
+    del _broadcast_event_ids[:]
     _publish(None)
     logging.info('Колокол: слушатель %s подключён, отправлена сверка',
                  BELL_NOTIFY_CHANNEL)
@@ -116,16 +264,21 @@ def _subscribe(conn):
 
 def _run_listener(connect):
     """Вечный цикл слушателя на СОБСТВЕННОМ соединении — пул приложения не трогаем."""
+    global _listener_live
     while True:
         conn = None
         try:
             conn = connect()
             cursor = _subscribe(conn)
             while True:
-                readable, _, _ = select.select([conn], [], [], HEARTBEAT_SECONDS)
+                timeout = HEARTBEAT_SECONDS
+                if _broadcast_due_at is not None:
+                    timeout = max(0.0, min(timeout, _broadcast_due_at - time.monotonic()))
+                readable, _, _ = select.select([conn], [], [], timeout)
                 conn.poll()
                 got_notify = _drain_notifies(conn)
-                if not readable and not got_notify:
+                flushed = _flush_broadcast()
+                if not readable and not got_notify and not flushed:
                     # Тишина — держим соединение живым. Сам запрос может втянуть
                     # ожидающие NOTIFY в conn.notifies, поэтому после него ещё раз.
                     cursor.execute('SELECT 1')
@@ -134,6 +287,7 @@ def _run_listener(connect):
         except Exception:
             logging.exception('Колокол: слушатель %s упал, переподключение', BELL_NOTIFY_CHANNEL)
         finally:
+            _listener_live = False
             try:
                 if conn is not None:
                     conn.close()
@@ -159,11 +313,79 @@ def ensure_listener(connect):
         _listener_started = True
 
 
+def listener_live():
+    """Слушает ли процесс bell_events прямо сейчас — условие доверия кешу сводки."""
+    return _listener_live
+
+
 def current_seq():
     with _condition:
         return _seq
 
 
+def cursor_id(seq):
+    """Сквозной курсор для id: кадра, отправленного на локальном тычке seq.
+
+    0 — сквозных номеров процесс ещё не видел (или seq уже вне кольца):
+    такой курсор нигде не найдётся, и возобновление уйдёт в reload.
+    """
+    with _condition:
+        if seq == _seq:
+            return _mark
+        if _ticks and _ticks[0].seq <= seq <= _ticks[-1].seq:
+            return _ticks[seq - _ticks[0].seq].mark
+        return 0
+
+
+def _scan_ticks_locked(after_seq, user_id):
+    """(есть ли тычок для user_id после after_seq, новый курсор). Только под _condition."""
+    # Если курсор старше самого раннего сохранённого элемента, часть
+    # тычков уже вытеснена из deque. Нельзя заключать, что среди них не
+    # было адресной для этого пользователя: принудительная перечитка
+    # сводки дешевле и восстанавливает точное состояние.
+    oldest_seq = _ticks[0].seq if _ticks else _seq + 1
+    if after_seq < oldest_seq - 1:
+        return True, _seq
+    for tick in reversed(_ticks):
+        if tick.seq <= after_seq:
+            break
+        if tick.targets is None or user_id in tick.targets:
+            return True, _seq
+    return False, _seq
+
+
+def _changes_locked(after_seq, user_id):
+    """(BellChanges для user_id после after_seq либо None, новый курсор).
+
+    Только под _condition. Разрыв курсора и тычок без источника дают
+    BellChanges(None, ...) — полную перечитку, по той же причине, что и в
+    _scan_ticks_locked: угадывать, что было в вытесненном, нельзя.
+    """
+    oldest_seq = _ticks[0].seq if _ticks else _seq + 1
+    if after_seq < oldest_seq - 1 or after_seq > _seq:
+        return BellChanges(None, frozenset()), _seq
+    sources, rows, matched = set(), set(), False
+    for tick in reversed(_ticks):
+        if tick.seq <= after_seq:
+            break
+        if tick.targets is not None and user_id not in tick.targets:
+            continue
+        if tick.sources is None:
+            return BellChanges(None, frozenset()), _seq
+        matched = True
+        sources |= tick.sources
+        rows |= tick.rows
+    if not matched:
+        return None, _seq
+    return BellChanges(frozenset(sources), frozenset(rows)), _seq
+
+
+def poll_tick(after_seq, user_id):
+    """То же, что wait_for_tick, но без ожидания — для асинхронного шлюза (sse_gateway.py)."""
+    with _condition:
+        return _scan_ticks_locked(after_seq, user_id)
+
+
 def wait_for_tick(after_seq, user_id, timeout_seconds):
     """(есть ли тычок для user_id после after_seq, новый курсор).
 
@@ -173,22 +395,7 @@ def wait_for_tick(after_seq, user_id, timeout_seconds):
     deadline = time.monotonic() + max(0.1, float(timeout_seconds or 0.1))
     with _condition:
         while True:
-            # Если курсор старше самого раннего сохранённого элемента, часть
-            # тычков уже вытеснена из deque. Нельзя заключать, что среди них не
-            # было адресной для этого пользователя: принудительная перечитка
-            # сводки дешевле и восстанавливает точное состояние.
-            oldest_seq = _ticks[0][0] if _ticks else _seq + 1
-            if after_seq < oldest_seq - 1:
-                return True, _seq
-
-            matched = False
-            for seq, targets in reversed(_ticks):
-                if seq <= after_seq:
-                    break
-                if targets is None or user_id in targets:
-                    matched = True
-                    break
-            cursor_seq = _seq
+            matched, cursor_seq = _scan_ticks_locked(after_seq, user_id)
             if matched:
                 return True, cursor_seq
             after_seq = cursor_seq
@@ -198,6 +405,74 @@ def wait_for_tick(after_seq, user_id, timeout_seconds):
             _condition.wait(timeout=remaining)
 
 
+def poll_changes(after_seq, user_id):
+    """То же, что wait_for_changes, но без ожидания — для sse_gateway.py."""
+    with _condition:
+        return _changes_locked(after_seq, user_id)
+
+
+def wait_for_changes(after_seq, user_id, timeout_seconds):
+    """(BellChanges для user_id после after_seq либо None по таймауту, новый курсор)."""
+    deadline = time.monotonic() + max(0.1, float(timeout_seconds or 0.1))
+    with _condition:
+        while True:
+            changes, cursor_seq = _changes_locked(after_seq, user_id)
+            if changes is not None:
+                return changes, cursor_seq
+            after_seq = cursor_seq
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None, cursor_seq
+            _condition.wait(timeout=remaining)
+
+
+def resume_seq(after_id):
+    """(локальный seq, покрыт ли курсор кольцом) для возобновления потока дельт.
+
+    after_id — сквозной курсор из id: (см. cursor_id), выданный этим или любым
+    другим процессом. Без курсора — с текущего тычка: клиент только что
+    подключился и сам прочитает сводку. Курсор, которого в кольце нет, не
+    покрыт: потоку остаётся полная перечитка.
+
+    Найденный курсор отступает назад: тычок с ним — если в него влито ещё
+    что-то после курсора — и всё, что опубликовано за RESUME_REWIND_SECONDS до
+    него, присылается снова. Так широковещательный тычок, который здесь
+    склеился раньше, а в выдавшем курсор процессе позже, не теряется.
+    """
+    with _condition:
+        if after_id is None:
+            return _seq, True
+        seq = _event_index.get(after_id)
+        if seq is None or not _ticks or seq < _ticks[0].seq:
+            return _seq, False
+        oldest_seq = _ticks[0].seq
+        index = seq - oldest_seq
+        tick = _ticks[index]
+        # start — первый тычок, который уйдёт клиенту заново.
+        start = index + 1 if tick.event_ids[-1] == after_id else index
+        horizon = tick.at - RESUME_REWIND_SECONDS
+        while index > 0 and _ticks[index - 1].at >= horizon:
+            index -= 1
+            start = index
+        if index == 0 and oldest_seq > 1:
+            # Отступ упёрся в начало кольца: вытесненное перед ним тоже могло
+            # попасть в окно, а что в нём было, уже не узнать.
+            return _seq, False
+        return oldest_seq + start - 1, True
+
+
+def wait_for_seq(after_seq, timeout_seconds):
+    """Дождаться любого тычка после after_seq (или таймаута) и вернуть текущий курсор.
+
+    Одна нить шлюза ждёт здесь за все его соединения разом, а кому из них тычок
+    адресован, каждое соединение выясняет само через poll_tick.
+    """
+    with _condition:
+        if _seq <= after_seq:
+            _condition.wait(timeout=max(0.1, float(timeout_seconds or 0.1)))
+        return _seq
+
+
 def try_acquire_stream_slot(limit):
     global _active_streams
     with _streams_lock:
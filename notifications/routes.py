@@ -8,9 +8,12 @@
 
 Роутов три: сводка, гашение и SSE-канал тычков (/stream). Принцип «вход в
 портал стоит ОДИН запрос» цел: /stream не считает ничего сам — он лишь будит
-клиента, и тот перечитывает ту же единственную сводку.
+клиента, и тот перечитывает ту же единственную сводку. Исключение — режим
+дельт (?mode=delta): там поток сам пересчитывает изменившиеся источники и
+шлёт их клиенту, избавляя его от обратного запроса (см. make_delta_builder).
 """
 
+import json
 import logging
 import time
 
@@ -20,16 +23,111 @@ from . import realtime
 from . import sources as notif_sources
 
 
+def parse_limit(value):
+    """Размер порции из параметра запроса; мусор — порция по умолчанию."""
+    try:
+        return int(value or notif_sources.ITEMS_PER_SOURCE)
+    except (TypeError, ValueError):
+        return notif_sources.ITEMS_PER_SOURCE
+
+
+def parse_after(value):
+    """Курсор возобновления потока дельт (?after= или Last-Event-ID) либо None."""
+    try:
+        after = int(value)
+    except (TypeError, ValueError):
+        return None
+    return after if after >= 0 else None
+
+
+def make_delta_builder(*, db, viewer_context, summary_cache=lambda: None):
+    """build(user_id, requester, changes, limit, event_id) -> dict дельты либо None.
+
+    Дельта — это сводка, в которой элементы есть только у изменившихся
+    источников (changes.sources), а счётчики, has_more и next_change_in — целиком:
+    их клиент просто заменяет, элементы же вливает вместо своих по этим
+    источникам. Через кеш сводки считаются только изменившиеся источники —
+    их как раз сбросил тот же тычок. None — собрать не удалось: поток шлёт
+    reload, и клиент перечитывает сводку обычным запросом.
+
+    Общий для маршрута waitress и SSE-шлюза, поэтому вне фабрики блюпринта.
+    """
+
+    def build(user_id, requester, changes, limit, event_id):
+        limit = notif_sources.clamp_limit(limit)
+        try:
+            viewer = viewer_context(user_id, requester)
+            with db._get_cursor() as cursor:
+                counts, items, meta = notif_sources.collect(
+                    cursor, viewer, limit=limit, cache=summary_cache())
+        except Exception:
+            logging.exception('Центр уведомлений: не удалось собрать дельту')
+            return None
+        changed = sorted(changes.sources)
+        rows = {}
+        for source, row in changes.rows:
+            rows.setdefault(source, []).append(row)
+        return {
+            'seq': event_id,
+            'sources': changed,
+            'rows': {source: sorted(ids) for source, ids in rows.items()},
+            'order': list(notif_sources.SOURCES),
+            'limit': limit,
+            'counts': counts,
+            'items': [item for item in items if item['source'] in changes.sources],
+            'has_more': meta['has_more'],
+            'next_change_in': meta['next_change_in'],
+        }
+
+    return build
+
+
+def delta_frame(build_delta, user_id, requester, changes, limit, seq):
+    """SSE-кадр для набора изменений: delta, а при любой неясности — reload.
+
+    seq — локальный номер тычка; в id: уходит сквозной курсор (realtime.cursor_id),
+    с которым клиента возобновит любой процесс.
+    """
+    event_id = realtime.cursor_id(seq)
+    if changes.sources is not None:
+        delta = build_delta(user_id, requester, changes, limit, event_id)
+        if delta is not None:
+            return "id: %d\nevent: delta\ndata: %s\n\n" % (
+                event_id, json.dumps(delta, ensure_ascii=False, default=str))
+    return reload_frame(seq)
+
+
+def reload_frame(seq):
+    return "id: %d\nevent: reload\ndata: {}\n\n" % realtime.cursor_id(seq)
+
+
 def build_notifications_blueprint(*, db, require_api_key, build_cors_preflight_response,
                                   resolve_requester, viewer_context,
-                                  listen_connect=None, stream_limit=50):
+                                  listen_connect=None, stream_limit=50,
+                                  cache_summaries=False, stream_deltas=False):
     """viewer_context(requester_id, requester) -> dict для sources.collect.
 
     listen_connect() -> новое psycopg2-соединение для LISTEN (своё, вне пула).
     Без него /stream отвечает 503 и колокол живёт на обновлении по фокусу —
     так же блюпринт ведёт себя в юнит-тестах, где базы нет.
+
+    cache_summaries — отдавать сводку через кеш realtime.summary_cache. Нужен
+    тот же listen_connect: кеш сбрасывают тычки, и без живого слушателя в ЭТОМ
+    процессе сводка считается целиком, как раньше.
+
+    stream_deltas — разрешить клиентам режим дельт у /stream. Клиент просит его
+    сам (?mode=delta), без флага поток молча остаётся на тычках reload.
     """
 
+    def _summary_cache():
+        if not cache_summaries or listen_connect is None:
+            return None
+        realtime.ensure_listener(listen_connect)
+        return realtime.summary_cache if realtime.listener_live() else None
+
+    build_delta = make_delta_builder(db=db, viewer_context=viewer_context,
+                                     summary_cache=_summary_cache)
+
     bp = Blueprint('notifications', __name__, url_prefix='/api/notifications')
 
     def _authenticated():
@@ -64,13 +162,11 @@ def build_notifications_blueprint(*, db, require_api_key, build_cors_preflight_r
             # источник, и шестая задача была недостижима. Значение вне диапазона
             # не ошибка, а повод взять ближайшее допустимое — сводка важнее
             # придирок к параметру.
-            try:
-                limit = int(request.args.get('limit') or notif_sources.ITEMS_PER_SOURCE)
-            except (TypeError, ValueError):
-                limit = notif_sources.ITEMS_PER_SOURCE
+            limit = parse_limit(request.args.get('limit'))
 
             with db._get_cursor() as cursor:
-                counts, items, meta = notif_sources.collect(cursor, viewer, limit=limit)
+                counts, items, meta = notif_sources.collect(
+                    cursor, viewer, limit=limit, cache=_summary_cache())
         except Exception:
             # Сюда долетает НЕ падение отдельного раздела — оно уже изолировано
             # SAVEPOINT'ом внутри collect() и даёт по нему ноль, — а отказ
@@ -132,6 +228,10 @@ def build_notifications_blueprint(*, db, require_api_key, build_cors_preflight_r
             for name in wanted:
                 if notif_sources.mark_seen(cursor, viewer['user_id'], name):
                     marked.append(name)
+        # Тычок триггера тоже сбросит кеш, но он может прийти позже, чем клиент
+        # перечитает сводку сразу после гашения, — свой сброс не ждёт NOTIFY.
+        for name in marked:
+            realtime.summary_cache.invalidate(frozenset({viewer['user_id']}), name)
         return jsonify({"status": "success", "marked": marked}), 200
 
     @bp.route('/stream', methods=('GET', 'OPTIONS'))
@@ -143,6 +243,11 @@ def build_notifications_blueprint(*, db, require_api_key, build_cors_preflight_r
         мест ровно stream_limit: сверх лимита — 503, клиент молча остаётся на
         обновлении по фокусу и попробует позже. Периметр зрителя здесь не
         нужен: тычок не несёт данных, а перечитка сводки фильтруется сервером.
+
+        В режиме дельт (?mode=delta&limit=N&after=seq) периметр нужен: поток
+        считает сводку сам, тем же collect(), что и GET сводки. Каждый кадр
+        несёт id: — сквозной курсор, с которого клиент продолжит после обрыва
+        в этом или любом другом процессе.
         """
         if request.method == 'OPTIONS':
             return build_cors_preflight_response()
@@ -154,6 +259,9 @@ def build_notifications_blueprint(*, db, require_api_key, build_cors_preflight_r
             message, status_code = auth_error
             return jsonify({"error": message}), status_code
         user_id = int(requester_id)
+        deltas = stream_deltas and request.args.get('mode') == 'delta'
+        limit = parse_limit(request.args.get('limit'))
+        after = parse_after(request.args.get('after') or request.headers.get('Last-Event-ID'))
 
         realtime.ensure_listener(listen_connect)
         if not realtime.try_acquire_stream_slot(stream_limit):
@@ -161,6 +269,20 @@ def build_notifications_blueprint(*, db, require_api_key, build_cors_preflight_r
             response.headers['Retry-After'] = '300'
             return response, 503
 
+        def generate_deltas():
+            cursor_seq, covered = realtime.resume_seq(after)
+            yield ": connected %d\n\n" % int(time.time())
+            if not covered:
+                # Курсор выпал из кольца: что было пропущено, уже не узнать.
+                yield reload_frame(cursor_seq)
+            while True:
+                changes, cursor_seq = realtime.wait_for_changes(
+                    cursor_seq, user_id, realtime.HEARTBEAT_SECONDS)
+                if changes is None:
+                    yield ": heartbeat %d\n\n" % int(time.time())
+                    continue
+                yield delta_frame(build_delta, user_id, requester, changes, limit, cursor_seq)
+
         def generate():
             cursor_seq = realtime.current_seq()
             yield ": connected %d\n\n" % int(time.time())
@@ -181,7 +303,8 @@ def build_notifications_blueprint(*, db, require_api_key, build_cors_preflight_r
                     # считают молчащее соединение мёртвым.
                     yield ": heartbeat %d\n\n" % int(time.time())
 
-        response = Response(generate(), mimetype='text/event-stream')
+        response = Response(generate_deltas() if deltas else generate(),
+                            mimetype='text/event-stream')
         response.headers['Cache-Control'] = 'no-cache'
         response.headers['X-Accel-Buffering'] = 'no'
         # Слот возвращается, когда WSGI-сервер закрывает ответ, — это надёжнее
@@ -516,7 +516,20 @@ _HANDLERS = {
 }
 
 
-def collect(cursor, viewer, only=None, limit=ITEMS_PER_SOURCE):
+def clamp_limit(limit):
+    """Размер порции на источник в допустимых границах."""
+    # Любая бессмыслица (ноль, отрицательное, не число) — это «клиент не указал
+    # порцию», а не «отдай одну строку»: берём дефолт, а не крайность.
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return ITEMS_PER_SOURCE
+    if limit < 1:
+        return ITEMS_PER_SOURCE
+    return min(limit, MAX_ITEMS_PER_SOURCE)
+
+
+def collect(cursor, viewer, only=None, limit=ITEMS_PER_SOURCE, cache=None):
     """(счётчики, элементы, есть ли ещё) по всем доступным зрителю источникам.
 
     Каждый источник считается под SAVEPOINT: раздел может быть ещё не
@@ -527,33 +540,37 @@ def collect(cursor, viewer, only=None, limit=ITEMS_PER_SOURCE):
     считают ВСЁ, а элементов отдаётся не больше limit на источник, и без этого
     флага бейдж «6» висел бы над пятью карточками без всякой возможности
     добраться до шестой.
+
+    cache — notifications.cache.SummaryCache: источники, которые триггеры не
+    сбрасывали, берутся из него, и считается только изменившееся. Источник,
+    упавший под SAVEPOINT, в кеш не кладётся — его ноль не результат.
     """
-    # Любая бессмыслица (ноль, отрицательное, не число) — это «клиент не указал
-    # порцию», а не «отдай одну строку»: берём дефолт, а не крайность.
-    try:
-        limit = int(limit)
-    except (TypeError, ValueError):
-        limit = ITEMS_PER_SOURCE
-    if limit < 1:
-        limit = ITEMS_PER_SOURCE
-    limit = min(limit, MAX_ITEMS_PER_SOURCE)
+    limit = clamp_limit(limit)
     wanted = [s for s in SOURCES if s in _HANDLERS and (not only or s in only)]
     counts, items = {}, []
     has_more = False
+    epoch, cached = cache.lookup(viewer, limit) if cache is not None else (0, {})
 
     for name in wanted:
         if name in viewer.get('hidden_sources', ()):  # раздел закрыт для роли
             counts[name] = 0
             continue
-        cursor.execute('SAVEPOINT notif_source')
-        try:
-            count, source_items = _HANDLERS[name](cursor, viewer, limit)
-            cursor.execute('RELEASE SAVEPOINT notif_source')
-        except Exception:
-            cursor.execute('ROLLBACK TO SAVEPOINT notif_source')
-            cursor.execute('RELEASE SAVEPOINT notif_source')
-            logging.exception('Уведомления: источник %s не посчитан', name)
-            count, source_items = 0, []
+        if name in cached:
+            count, source_items = cached[name]
+        else:
+            cursor.execute('SAVEPOINT notif_source')
+            try:
+                count, source_items = _HANDLERS[name](cursor, viewer, limit)
+                cursor.execute('RELEASE SAVEPOINT notif_source')
+                if cache is not None:
+                    cache.store(viewer, limit, epoch, name, (count, list(source_items)))
+            except Exception:
+                cursor.execute('ROLLBACK TO SAVEPOINT notif_source')
+                cursor.execute('RELEASE SAVEPOINT notif_source')
+                logging.exception('Уведомления: источник %s не посчитан', name)
+                count, source_items = 0, []
+        if cache is not None:
+            cache.count(name in cached)
         counts[name] = int(count or 0)
         # Оба условия обязательны. Одного «счётчик больше показанного» мало:
         # «4 You» сворачивает любое число фото в ОДНУ строку «Новые фото: 12»,
@@ -576,20 +593,37 @@ def collect(cursor, viewer, only=None, limit=ITEMS_PER_SOURCE):
     # Момент следующего перехода по часам — под тем же SAVEPOINT: он заменяет
     # фоновую сверку, но сам по себе не настолько важен, чтобы из-за него
     # разваливалась вся сводка.
-    cursor.execute('SAVEPOINT notif_next_change')
-    try:
-        upcoming = next_change_at(cursor, viewer)
-        cursor.execute('RELEASE SAVEPOINT notif_next_change')
-    except Exception:
-        cursor.execute('ROLLBACK TO SAVEPOINT notif_next_change')
-        cursor.execute('RELEASE SAVEPOINT notif_next_change')
-        logging.exception('Уведомления: не удалось вычислить следующий переход')
-        upcoming = None
+    #
+    # Из кеша он берётся на тех же правах, что и источники: его сбрасывают
+    # только те разделы, чьи сроки он читает, а полночь дней рождения
+    # пересчитывается здесь же, без базы.
+    if NEXT_CHANGE_KEY in cached:
+        upcoming = cached[NEXT_CHANGE_KEY]
+    else:
+        cursor.execute('SAVEPOINT notif_next_change')
+        try:
+            upcoming = next_change_at(cursor, viewer)
+            cursor.execute('RELEASE SAVEPOINT notif_next_change')
+            if cache is not None:
+                cache.store(viewer, limit, epoch, NEXT_CHANGE_KEY, upcoming,
+                            depends_on=NEXT_CHANGE_SOURCES,
+                            wake_in=_seconds_until(upcoming))
+        except Exception:
+            cursor.execute('ROLLBACK TO SAVEPOINT notif_next_change')
+            cursor.execute('RELEASE SAVEPOINT notif_next_change')
+            logging.exception('Уведомления: не удалось вычислить следующий переход')
+            upcoming = None
 
     meta = {'has_more': has_more, 'next_change_in': _seconds_until(upcoming)}
     return counts, items, meta
 
 
+# Ключ next_change_at в кеше сводки и разделы, чьи сроки он читает: сброс любого
+# из них сбрасывает и его (см. next_change_at ниже).
+NEXT_CHANGE_KEY = 'next_change'
+NEXT_CHANGE_SOURCES = ('surveys', 'tasks', 'wiki_ack')
+
+
 def next_change_at(cursor, viewer):
     """Ближайший момент, когда сводка изменится САМА, без чьего-либо действия.
 
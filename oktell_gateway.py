@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""Общий шлюз к прокси Oktell: склейка одинаковых запросов, кэш закрытых дней, очередь с приоритетами.
+
+Все потребители Oktell (табло, ночные и внутридневные синки статусов, звонков
+и ресурсов, отчёты биллинга, поиск записей) ходили в прокси напрямую через
+_oktell_query, и единственной защитой был кэш и замок самого табло. Прокси
+низкоконкурентный: десять супервайзеров, открывших один и тот же день
+биллинга, давали ему десять одинаковых тяжёлых SELECT разом, а ночной синк в
+это время стоял с ними в одной очереди наравне с табло.
+
+СКЛЕЙКА (single-flight). Тот же SQL, уже идущий в прокси, второй раз не
+отправляется: опоздавшие ждут ответа первого и получают его копию (или его
+ошибку). Очередь к прокси они не занимают. Опоздавший с таймаутом ждёт первого
+не дольше этого таймаута и, как в очереди, получает OktellGatewayBusy.
+
+КЭШ ЗАКРЫТЫХ ДНЕЙ. Вызывающий передаёт closed_day — последний день, который
+покрывает запрос. Если день уже закрыт (раньше «сегодня» по часам Oktell),
+ответ кэшируется по (sql, день) на cache_ttl_seconds: данные закрытых суток
+больше не меняются, а повторный заход в тот же отчёт не стоит прокси ничего.
+Открытые сутки не кэшируются никогда. Кэш ограничен числом строк, а не
+записей: одна страница построчной выгрузки весит как сотня сводок.
+
+ОЧЕРЕДЬ. Одновременно в прокси идут не больше max_concurrency запросов.
+Освободившийся слот получает ждущий с наивысшим приоритетом: табло раньше
+интерактивного отчёта, отчёт раньше ночного синка. Запрос с таймаутом
+(табло) в очереди ждёт не дольше этого таймаута и получает OktellGatewayBusy —
+экрану лучше показать прошлый снимок, чем висеть.
+
+УЧЁТ. По потребителю (метка как у пула PostgreSQL: route:<endpoint>,
+job:<имя>, thread:<пул>) — вызовы, реальные запросы в прокси, склейки,
+попадания в кэш, ошибки, отказы очереди, время в прокси и в очереди.
+
+Модуль не импортирует bot_schedule2: сетевой вызов передаётся в OktellGateway.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+import pg_pool_metrics
+
+PRIORITY_WALLBOARD = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_SYNC = 2
+
+
+class OktellGatewayBusy(RuntimeError):
+    """Слот к прокси (или ответ склеенного запроса) не дождался за отведённое запросу время."""
+
+
+def default_priority(consumer):
+    """Запрос из HTTP-ручки — интерактивный, всё остальное (джобы, пулы нитей) — синк."""
+    return PRIORITY_INTERACTIVE if str(consumer or '').startswith('route:') else PRIORITY_SYNC
+
+
+class _PrioritySlots:
+    """Семафор, отдающий освободившийся слот ждущему с наименьшим номером приоритета.
+
+    При равном приоритете — в порядке прихода."""
+
+    def __init__(self, slots):
+        self.slots = max(1, int(slots))
+        self._free = self.slots
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._seq = itertools.count()
+
+    def acquire(self, priority, timeout=None):
+        with self._lock:
+            if self._free > 0 and not self._waiters:
+                self._free -= 1
+                return True
+            entry = [int(priority), next(self._seq), threading.Event(), False]
+            heapq.heappush(self._waiters, entry)
+        if entry[2].wait(timeout):
+            return True
+        with self._lock:
+            # Слот могли отдать ровно в момент таймаута — тогда он наш.
+            if entry[2].is_set():
+                return True
+            entry[3] = True
+            return False
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                entry = heapq.heappop(self._waiters)
+                if entry[3]:
+                    continue
+                entry[2].set()
+                return
+            self._free += 1
+
+    def state(self):
+        with self._lock:
+            queued = sum(1 for entry in self._waiters if not entry[3])
+            return {'slots': self.slots, 'in_use': self.slots - self._free, 'queued': queued}
+
+
+class _Flight:
+    __slots__ = ('done', 'rows', 'error', 'followers')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.rows = None
+        self.error = None
+        self.followers = 0
+
+
+def _copy_rows(rows):
+    # Вызывающие вправе менять строки; общий ответ (кэш, склейка) делить по ссылке нельзя.
+    return [dict(row) if isinstance(row, dict) else row for row in (rows or [])]
+
+
+def _new_stats(label):
+    return {
+        'consumer': label,
+        'calls': 0,
+        'proxy_queries': 0,
+        'coalesced': 0,
+        'cache_hits': 0,
+        'errors': 0,
+        'busy': 0,
+        'proxy_total_s': 0.0,
+        'proxy_max_s': 0.0,
+        'queue_total_s': 0.0,
+        'queue_max_s': 0.0,
+        'last_error': None,
+    }
+
+
+class OktellGateway:
+    """Шлюз (см. docstring модуля). fetch(sql, timeout) -> список строк — сам сетевой вызов."""
+
+    def __init__(self, fetch, *, max_concurrency=2, cache_ttl_seconds=6 * 3600,
+                 cache_max_rows=200000, today=None, clock=time.monotonic):
+        self._fetch = fetch
+        self._slots = _PrioritySlots(max_concurrency)
+        self.cache_ttl_seconds = float(cache_ttl_seconds)
+        self.cache_max_rows = max(0, int(cache_max_rows))
+        self._today = today
+        self._clock = clock
+        self._flights_lock = threading.Lock()
+        self._flights = {}
+        self._cache_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_rows = 0
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    # --- публичное ---------------------------------------------------------------------------
+
+    def query(self, sql, timeout=None, *, priority=None, closed_day=None, consumer=None):
+        consumer = consumer or pg_pool_metrics.current_consumer()
+        if priority is None:
+            priority = default_priority(consumer)
+        self._count(consumer, 'calls')
+
+        cache_key = self._cache_key(sql, closed_day)
+        if cache_key is not None:
+            rows = self._cache_get(cache_key)
+            if rows is not None:
+                self._count(consumer, 'cache_hits')
+                return _copy_rows(rows)
+
+        with self._flights_lock:
+            flight = self._flights.get(sql)
+            leader = flight is None
+            if leader:
+                flight = self._flights[sql] = _Flight()
+            else:
+                flight.followers += 1
+        if not leader:
+            self._count(consumer, 'coalesced')
+            if not flight.done.wait(timeout):
+                self._count(consumer, 'busy')
+                raise OktellGatewayBusy(
+                    f"Oktell: прокси занят, такой же запрос не ответил за {timeout} с")
+            if flight.error is not None:
+                raise flight.error
+            return _copy_rows(flight.rows)
+
+        try:
+            rows = self._run(sql, timeout, priority, consumer)
+            flight.rows = rows
+            if cache_key is not None:
+                self._cache_put(cache_key, rows)
+        except BaseException as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._flights_lock:
+                self._flights.pop(sql, None)
+            flight.done.set()
+        # Свой ответ отдаём как есть, если его больше никто не держит (ни опоздавшие, ни кэш).
+        return _copy_rows(rows) if flight.followers or cache_key is not None else rows
+
+    def snapshot(self):
+        """Сводка для админского эндпоинта: очередь, кэш, потребители (от самых дорогих)."""
+        with self._stats_lock:
+            rows = [dict(stats) for stats in self._stats.values()]
+        for row in rows:
+            queries = row['proxy_queries'] or 0
+            row['proxy_avg_ms'] = round(row['proxy_total_s'] * 1000 / queries, 2) if queries else 0.0
+            row['queue_avg_ms'] = round(row['queue_total_s'] * 1000 / queries, 2) if queries else 0.0
+            row['saved'] = row['coalesced'] + row['cache_hits']
+            for key in ('proxy_total_s', 'proxy_max_s', 'queue_total_s', 'queue_max_s'):
+                row[key] = round(row[key], 4)
+        rows.sort(key=lambda row: (row['proxy_total_s'], row['queue_total_s']), reverse=True)
+        with self._cache_lock:
+            cache = {
+                'entries': len(self._cache),
+                'rows': self._cache_rows,
+                'max_rows': self.cache_max_rows,
+                'ttl_seconds': self.cache_ttl_seconds,
+            }
+        with self._flights_lock:
+            in_flight = len(self._flights)
+        return {'slots': {**self._slots.state(), 'in_flight': in_flight}, 'cache': cache, 'consumers': rows}
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats.clear()
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+            self._cache_rows = 0
+
+    # --- внутреннее --------------------------------------------------------------------------
+
+    def _run(self, sql, timeout, priority, consumer):
+        queued_at = self._clock()
+        if not self._slots.acquire(priority, timeout):
+            self._count(consumer, 'busy')
+            raise OktellGatewayBusy(
+                f"Oktell: прокси занят, слот не освободился за {timeout} с")
+        started = self._clock()
+        try:
+            rows = self._fetch(sql, timeout)
+        except Exception as exc:
+            self._record(consumer, started - queued_at, self._clock() - started, error=exc)
+            raise
+        finally:
+            self._slots.release()
+        self._record(consumer, started - queued_at, self._clock() - started)
+        return rows
+
+    def _cache_key(self, sql, closed_day):
+        if (closed_day is None or self._today is None
+                or self.cache_max_rows <= 0 or self.cache_ttl_seconds <= 0):
+            return None
+        if closed_day >= self._today():
+            return None
+        return (sql, closed_day)
+
+    def _cache_get(self, key):
+        now = self._clock()
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            expires_at, rows = entry
+            if expires_at <= now:
+                self._cache.pop(key, None)
+                self._cache_rows -= len(rows)
+                return None
+            self._cache.move_to_end(key)
+            return rows
+
+    def _cache_put(self, key, rows):
+        rows = list(rows or [])
+        if len(rows) > self.cache_max_rows:
+            return
+        with self._cache_lock:
+            previous = self._cache.pop(key, None)
+            if previous is not None:
+                self._cache_rows -= len(previous[1])
+            self._cache[key] = (self._clock() + self.cache_ttl_seconds, rows)
+            self._cache_rows += len(rows)
+            while self._cache_rows > self.cache_max_rows and self._cache:
+                _key, (_expires_at, evicted) = self._cache.popitem(last=False)
+                self._cache_rows -= len(evicted)
+
+    def _stats_for(self, consumer):
+        stats = self._stats.get(consumer)
+        if stats is None:
+            stats = self._stats[consumer] = _new_stats(consumer)
+        return stats
+
+    def _count(self, consumer, key):
+        with self._stats_lock:
+            self._stats_for(consumer)[key] += 1
+
+    def _record(self, consumer, queue_s, proxy_s, error=None):
+        with self._stats_lock:
+            stats = self._stats_for(consumer)
+            stats['proxy_queries'] += 1
+            stats['proxy_total_s'] += proxy_s
+            stats['proxy_max_s'] = max(stats['proxy_max_s'], proxy_s)
+            stats['queue_total_s'] += queue_s
+            stats['queue_max_s'] = max(stats['queue_max_s'], queue_s)
+            if error is not None:
+                stats['errors'] += 1
+                stats['last_error'] = str(error)[:300]
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""Учёт пула PostgreSQL по потребителям и квоты соединений на потребителя.
+
+Пул один на процесс (database.MAX_CONN, по умолчанию 40), а делят его очень
+разные клиенты: логин и SSE аукциона смен, которым нужна одна короткая выдача
+за раз, и Excel-выгрузка месяца или ночной синк Oktell, которые держат
+соединение минутами и берут его снова и снова. Раньше под нагрузкой было видно
+только «Waited N s for PostgreSQL pool slot» — без ответа на вопрос, КТО занял
+слоты. Модуль отвечает на него и даёт ограничить жадного потребителя.
+
+ПОТРЕБИТЕЛЬ. Метка вида '<класс>:<имя>': 'route:<endpoint Flask>' ставит
+before_request, явный consumer('job:<id>') — фоновые задачи. Без явной метки
+она выводится из имени нити ('thread:executor', 'thread:group-late',
+'thread:waitress'), так что фоновая работа в пулах нитей видна и
+ограничивается целиком, без правки каждой джобы.
+
+КВОТА. POSTGRES_POOL_CONSUMER_BUDGETS='route:export_excel=4,thread:executor=12'.
+Квота ищется по полной метке, затем по классу до двоеточия ('job=10' — на все
+джобы сразу). Квота берётся ДО общего семафора пула: потребитель, упёршийся в
+свою квоту, ждёт в своей очереди и не занимает общий слот. Вложенная выдача в
+той же нити квоту повторно не берёт — иначе квота 1 сама себя бы заперла.
+
+ЗАПРОСЫ. Считаются курсором по умолчанию (CountingCursor ставится пулу как
+cursor_factory). Курсоры с явным cursor_factory (RealDictCursor и т.п.) в
+счётчик не попадают — цифра «запросов на выдачу» поэтому оценка снизу.
+
+Модуль не импортирует database: он тестируется без базы.
+"""
+
+import contextlib
+import contextvars
+import logging
+import re
+import threading
+import time
+
+import psycopg2.extensions
+
+# Отдельная выдача дольше этого попадает в журнал с меткой потребителя — то
+# самое «кто держит слот», которого не хватало в старом предупреждении.
+HOLD_WARN_SECONDS = 30.0
+
+_consumer_var = contextvars.ContextVar('pg_pool_consumer', default=None)
+# Накопитель одного HTTP-запроса: его читает Server-Timing.
+_trace_var = contextvars.ContextVar('pg_pool_trace', default=None)
+# Текущая выдача в этой нити: в неё считает CountingCursor.
+_checkout_var = contextvars.ContextVar('pg_pool_checkout', default=None)
+# Метки, чья квота уже взята выше по стеку этой нити.
+_held_budgets_var = contextvars.ContextVar('pg_pool_held_budgets', default=())
+
+_stats_lock = threading.Lock()
+_stats = {}
+_pool_in_use = 0
+_pool_in_use_peak = 0
+
+_budgets_lock = threading.Lock()
+_budget_limits = {}
+_budget_semaphores = {}
+
+_THREAD_SUFFIX_RE = re.compile(r'[-_]\d+(?:_\d+)?$')
+
+
+def parse_budgets(raw):
+    """'route:export_excel=4, job=10' → {'route:export_excel': 4, 'job': 10}.
+
+    Мусорные элементы пропускаются с предупреждением, а не роняют старт:
+    опечатка в переменной окружения не должна оставить сервис без базы.
+    """
+    budgets = {}
+    for item in str(raw or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        label, sep, value = item.rpartition('=')
+        label = label.strip()
+        try:
+            limit = int(value.strip())
+        except ValueError:
+            limit = 0
+        if not sep or not label or limit < 1:
+            logging.warning("POSTGRES_POOL_CONSUMER_BUDGETS: пропущен элемент %r", item)
+            continue
+        budgets[label] = limit
+    return budgets
+
+
+def configure_budgets(budgets):
+    """Задать квоты. Семафоры пересоздаются: ждущие на старых доработают как были."""
+    with _budgets_lock:
+        _budget_limits.clear()
+        _budget_limits.update(budgets or {})
+        _budget_semaphores.clear()
+
+
+def budget_label(label):
+    """Метка квоты, под которую попадает потребитель, или None."""
+    if not label:
+        return None
+    if label in _budget_limits:
+        return label
+    family = label.split(':', 1)[0]
+    if family != label and family in _budget_limits:
+        return family
+    return None
+
+
+def _budget_semaphore(key):
+    with _budgets_lock:
+        semaphore = _budget_semaphores.get(key)
+        if semaphore is None and key in _budget_limits:
+            semaphore = threading.BoundedSemaphore(_budget_limits[key])
+            _budget_semaphores[key] = semaphore
+        return semaphore
+
+
+def _thread_label():
+    name = threading.current_thread().name or ''
+    if name == 'MainThread':
+        return 'thread:main'
+    base = _THREAD_SUFFIX_RE.sub('', name)
+    if base.startswith('ThreadPoolExecutor'):
+        base = 'executor-unnamed'
+    return f"thread:{base or 'unknown'}"
+
+
+def current_consumer():
+    return _consumer_var.get() or _thread_label()
+
+
+@contextlib.contextmanager
+def consumer(label):
+    """Пометить выдачи внутри блока меткой потребителя."""
+    token = _consumer_var.set(str(label))
+    try:
+        yield
+    finally:
+        _consumer_var.reset(token)
+
+
+def bind(label, fn):
+    """Обёртка для run_in_executor: contextvars в нить пула сами не переезжают."""
+    def wrapped(*args, **kwargs):
+        with consumer(label):
+            return fn(*args, **kwargs)
+    return wrapped
+
+
+def set_request_consumer(label):
+    """Начать учёт HTTP-запроса. Возвращает токены для end_request."""
+    return _consumer_var.set(str(label)), _trace_var.set(_new_trace())
+
+
+def end_request(tokens):
+    consumer_token, trace_token = tokens
+    _trace_var.reset(trace_token)
+    _consumer_var.reset(consumer_token)
+
+
+def request_trace():
+    """Накопитель текущего запроса: ожидание/удержание в мс, выдачи, запросы."""
+    return _trace_var.get()
+
+
+def _new_trace():
+    return {'wait_ms': 0.0, 'hold_ms': 0.0, 'checkouts': 0, 'queries': 0}
+
+
+def _new_stats(label):
+    return {
+        'consumer': label,
+        'checkouts': 0,
+        'in_use': 0,
+        'in_use_peak': 0,
+        'timeouts': 0,
+        'budget_timeouts': 0,
+        'wait_total_s': 0.0,
+        'wait_max_s': 0.0,
+        'hold_total_s': 0.0,
+        'hold_max_s': 0.0,
+        'queries': 0,
+        'queries_max': 0,
+    }
+
+
+def _stats_for(label):
+    stats = _stats.get(label)
+    if stats is None:
+        stats = _stats[label] = _new_stats(label)
+    return stats
+
+
+def record_timeout(label, budget=False):
+    with _stats_lock:
+        stats = _stats_for(label)
+        stats['budget_timeouts' if budget else 'timeouts'] += 1
+
+
+class _Checkout:
+    __slots__ = ('label', 'queries', 'started_at')
+
+    def __init__(self, label):
+        self.label = label
+        self.queries = 0
+        self.started_at = time.perf_counter()
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Курсор по умолчанию для соединений пула: считает execute в текущую выдачу."""
+
+    def execute(self, query, vars=None):
+        checkout = _checkout_var.get()
+        if checkout is not None:
+            checkout.queries += 1
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        checkout = _checkout_var.get()
+        if checkout is not None:
+            checkout.queries += 1
+        return super().executemany(query, vars_list)
+
+
+@contextlib.contextmanager
+def acquire_budget(label, timeout):
+    """Взять квоту потребителя (если она задана). Без квоты — пустой блок.
+
+    Бросает TimeoutError('POSTGRES_POOL_BUDGET_TIMEOUT'), если квота не
+    освободилась за timeout секунд.
+    """
+    key = budget_label(label)
+    held = _held_budgets_var.get()
+    semaphore = _budget_semaphore(key) if key is not None and key not in held else None
+    if semaphore is None:
+        yield
+        return
+    if not semaphore.acquire(timeout=timeout):
+        record_timeout(label, budget=True)
+        raise TimeoutError("POSTGRES_POOL_BUDGET_TIMEOUT")
+    token = _held_budgets_var.set(held + (key,))
+    try:
+        yield
+    finally:
+        _held_budgets_var.reset(token)
+        semaphore.release()
+
+
+@contextlib.contextmanager
+def track_checkout(label, waited_seconds):
+    """Учесть одну выдачу соединения: ожидание, удержание, число запросов."""
+    global _pool_in_use, _pool_in_use_peak
+    checkout = _Checkout(label)
+    with _stats_lock:
+        stats = _stats_for(label)
+        stats['checkouts'] += 1
+        stats['in_use'] += 1
+        stats['in_use_peak'] = max(stats['in_use_peak'], stats['in_use'])
+        stats['wait_total_s'] += waited_seconds
+        stats['wait_max_s'] = max(stats['wait_max_s'], waited_seconds)
+        _pool_in_use += 1
+        _pool_in_use_peak = max(_pool_in_use_peak, _pool_in_use)
+    token = _checkout_var.set(checkout)
+    try:
+        yield checkout
+    finally:
+        _checkout_var.reset(token)
+        held_seconds = time.perf_counter() - checkout.started_at
+        with _stats_lock:
+            stats = _stats_for(label)
+            stats['in_use'] -= 1
+            stats['hold_total_s'] += held_seconds
+            stats['hold_max_s'] = max(stats['hold_max_s'], held_seconds)
+            stats['queries'] += checkout.queries
+            stats['queries_max'] = max(stats['queries_max'], checkout.queries)
+            _pool_in_use -= 1
+        trace = _trace_var.get()
+        if trace is not None:
+            trace['wait_ms'] += waited_seconds * 1000
+            trace['hold_ms'] += held_seconds * 1000
+            trace['checkouts'] += 1
+            trace['queries'] += checkout.queries
+        if HOLD_WARN_SECONDS and held_seconds >= HOLD_WARN_SECONDS:
+            logging.warning(
+                "PostgreSQL connection held %.1fs by %s (%s queries)",
+                held_seconds, label, checkout.queries
+            )
+
+
+def snapshot():
+    """Сводка для админского эндпоинта: по потребителям, от самых ждущих."""
+    with _stats_lock:
+        rows = [dict(stats) for stats in _stats.values()]
+        pool = {'in_use': _pool_in_use, 'in_use_peak': _pool_in_use_peak}
+    with _budgets_lock:
+        budgets = dict(_budget_limits)
+    for row in rows:
+        checkouts = row['checkouts'] or 0
+        row['wait_avg_ms'] = round(row['wait_total_s'] * 1000 / checkouts, 2) if checkouts else 0.0
+        row['hold_avg_ms'] = round(row['hold_total_s'] * 1000 / checkouts, 2) if checkouts else 0.0
+        row['queries_avg'] = round(row['queries'] / checkouts, 2) if checkouts else 0.0
+        for key in ('wait_total_s', 'wait_max_s', 'hold_total_s', 'hold_max_s'):
+            row[key] = round(row[key], 4)
+        key = budget_label(row['consumer'])
+        row['budget'] = {'label': key, 'limit': budgets[key]} if key else None
+    rows.sort(key=lambda row: (row['wait_total_s'], row['hold_total_s']), reverse=True)
+    return {'pool': pool, 'budgets': budgets, 'consumers': rows}
+
+
+def reset_stats():
+    """Обнулить накопленные счётчики. Текущие выдачи (in_use) сохраняются."""
+    global _pool_in_use_peak
+    with _stats_lock:
+        for label, stats in list(_stats.items()):
+            fresh = _new_stats(label)
+            fresh['in_use'] = fresh['in_use_peak'] = stats['in_use']
+            _stats[label] = fresh
+        _pool_in_use_peak = _pool_in_use
@@ -55,6 +55,8 @@ from pathlib import Path
 
 import requests
 
+import http_clients
+
 log = logging.getLogger(__name__)
 
 HTTP_TIMEOUT = 60
@@ -122,7 +124,7 @@ class RegContestClient:
         self.url = url
         self.token = token
         self.timeout = timeout
-        self.session = requests.Session()
+        self.session = http_clients.session("crm")
 
     @classmethod
     def from_config(cls, config=None):
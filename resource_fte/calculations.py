@@ -1,3 +1,5 @@
+import hashlib
+import json
 from collections import defaultdict
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional
@@ -11,6 +13,12 @@ INCIDENT_UPLIFT_CONFIDENCE_FLOOR = 0.35
 INCIDENT_UPLIFT_FORECAST_DAYS = 7
 INCIDENT_UPLIFT_FUTURE_MIN_WEIGHT = 0.55
 
+# Прогноз дня D строится по тем же дням недели за D-21 и D-14.
+FORECAST_HISTORY_OFFSETS_DAYS = (21, 14)
+# Поднимать при любом изменении формул профиля или всплеска: старый кэш станет чужим.
+FORECAST_CACHE_VERSION = 1
+FORECAST_PROFILE_SETTINGS_KEYS = ("answer_rate", "occ", "ur", "fte_rounding")
+
 
 def _build_profile_from_history_dates_tx(
     cursor,
@@ -228,8 +236,8 @@ def _apply_daily_aht_to_profile(profile: Dict[str, Any], settings: Dict[str, Any
 def _compute_forecast_profile_for_date_tx(cursor, forecast_date, settings: Dict[str, Any]) -> Dict[str, Any]:
     weekday = forecast_date.weekday()
     expected_history_dates = [
-        forecast_date - timedelta(days=21),
-        forecast_date - timedelta(days=14),
+        forecast_date - timedelta(days=offset)
+        for offset in FORECAST_HISTORY_OFFSETS_DAYS
     ]
     cursor.execute(
         """
@@ -253,15 +261,143 @@ def _compute_forecast_profile_for_date_tx(cursor, forecast_date, settings: Dict[
     }
 
 
+def _forecast_cache_key(kind: str, params: Dict[str, Any]) -> str:
+    raw = json.dumps(
+        {"kind": kind, "version": FORECAST_CACHE_VERSION, **params},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _forecast_profile_settings_hash(settings: Dict[str, Any]) -> str:
+    return _forecast_cache_key(
+        "profile",
+        {key: settings.get(key) for key in FORECAST_PROFILE_SETTINGS_KEYS},
+    )
+
+
+def _forecast_watermark(rows: List[Any]) -> str:
+    return ";".join(f"{report_date.isoformat()}@{updated_at.isoformat()}" for report_date, updated_at in rows)
+
+
+def _forecast_history_watermarks_tx(cursor, forecast_dates: List[Any]) -> Dict[Any, str]:
+    # Профиль дня зависит только от загрузок за D-21 и D-14: их updated_at и есть версия истории.
+    history_by_date = {
+        forecast_date: [forecast_date - timedelta(days=offset) for offset in FORECAST_HISTORY_OFFSETS_DAYS]
+        for forecast_date in forecast_dates
+    }
+    history_dates = sorted({day for days in history_by_date.values() for day in days})
+    cursor.execute(
+        """
+        SELECT report_date, updated_at
+        FROM raw_resource_uploads
+        WHERE report_date = ANY(%s)
+        """,
+        (history_dates,),
+    )
+    uploaded = {row[0]: row[1] for row in cursor.fetchall()}
+    return {
+        forecast_date: _forecast_watermark([(day, uploaded[day]) for day in days if day in uploaded])
+        for forecast_date, days in history_by_date.items()
+    }
+
+
+def _load_forecast_cache_tx(cursor, kind: str, cache_dates: List[Any], cache_key: str) -> Dict[Any, Any]:
+    cursor.execute(
+        """
+        SELECT cache_date, history_watermark, payload
+        FROM resource_forecast_cache
+        WHERE kind = %s
+          AND settings_hash = %s
+          AND cache_date = ANY(%s)
+        """,
+        (kind, cache_key, list(cache_dates)),
+    )
+    cached = {}
+    for cache_date, watermark, payload in cursor.fetchall():
+        if isinstance(payload, str):
+            payload = json.loads(payload)
+        cached[cache_date] = (watermark, payload)
+    return cached
+
+
+def _save_forecast_cache_tx(cursor, kind: str, cache_key: str, entries: List[Any]) -> None:
+    cache_dates = []
+    watermarks = []
+    payloads = []
+    for cache_date, watermark, payload in entries:
+        try:
+            encoded = json.dumps(payload, allow_nan=False)
+        except (TypeError, ValueError):
+            continue
+        cache_dates.append(cache_date)
+        watermarks.append(watermark)
+        payloads.append(encoded)
+    if not cache_dates:
+        return
+    # На дату держим одну запись: расчёт под прежними настройками больше не пригодится.
+    cursor.execute(
+        """
+        DELETE FROM resource_forecast_cache
+        WHERE kind = %s
+          AND cache_date = ANY(%s)
+          AND settings_hash <> %s
+        """,
+        (kind, cache_dates, cache_key),
+    )
+    cursor.execute(
+        """
+        INSERT INTO resource_forecast_cache (kind, cache_date, settings_hash, history_watermark, payload)
+        SELECT %s, item.cache_date, %s, item.history_watermark, item.payload
+        FROM unnest(%s::date[], %s::text[], %s::jsonb[]) AS item(cache_date, history_watermark, payload)
+        ON CONFLICT (kind, cache_date, settings_hash)
+        DO UPDATE SET
+            history_watermark = EXCLUDED.history_watermark,
+            payload = EXCLUDED.payload,
+            computed_at = CURRENT_TIMESTAMP
+        """,
+        (kind, cache_key, cache_dates, watermarks, payloads),
+    )
+
+
+def _compute_forecast_profiles_for_dates_tx(cursor, forecast_dates: List[Any], settings: Dict[str, Any]) -> List[Dict[str, Any]]:
+    forecast_dates = list(forecast_dates)
+    if not forecast_dates:
+        return []
+    settings_hash = _forecast_profile_settings_hash(settings)
+    watermarks = _forecast_history_watermarks_tx(cursor, forecast_dates)
+    cached = _load_forecast_cache_tx(cursor, "profile", sorted(set(forecast_dates)), settings_hash)
+    profiles = []
+    fresh = {}
+    for forecast_date in forecast_dates:
+        entry = cached.get(forecast_date)
+        if forecast_date in fresh:
+            profile = fresh[forecast_date]
+        elif entry is not None and entry[0] == watermarks[forecast_date]:
+            profile = entry[1]
+        else:
+            profile = _compute_forecast_profile_for_date_tx(cursor, forecast_date, settings)
+            fresh[forecast_date] = profile
+        profiles.append(profile)
+    _save_forecast_cache_tx(
+        cursor,
+        "profile",
+        settings_hash,
+        [(forecast_date, watermarks[forecast_date], profile) for forecast_date, profile in fresh.items()],
+    )
+    return profiles
+
+
 def _compute_period_forecast_profiles_tx(cursor, period_start, period_end, settings: Dict[str, Any]) -> List[Dict[str, Any]]:
     if period_end < period_start:
         period_start, period_end = period_end, period_start
-    profiles = []
+    forecast_dates = []
     current_date = period_start
     while current_date <= period_end:
-        profiles.append(_compute_forecast_profile_for_date_tx(cursor, current_date, settings))
+        forecast_dates.append(current_date)
         current_date += timedelta(days=1)
-    return profiles
+    return _compute_forecast_profiles_for_dates_tx(cursor, forecast_dates, settings)
 
 
 def _compute_week_forecast_profiles_tx(cursor, target_week_start, settings: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -406,7 +542,7 @@ def _compute_recent_incident_uplift_profile_tx(
         return _empty_incident_uplift_profile()
     cursor.execute(
         """
-        SELECT report_date
+        SELECT report_date, updated_at
         FROM daily_resource_summary
         WHERE report_date < %s
         ORDER BY report_date DESC
@@ -414,7 +550,8 @@ def _compute_recent_incident_uplift_profile_tx(
         """,
         (as_of_date, lookback_days),
     )
-    source_dates = [row[0] for row in cursor.fetchall()]
+    source_rows = cursor.fetchall()
+    source_dates = [row[0] for row in source_rows]
     if not source_dates:
         return {
             **_empty_incident_uplift_profile(),
@@ -423,6 +560,24 @@ def _compute_recent_incident_uplift_profile_tx(
             "forecast_window_end": (as_of_date + timedelta(days=INCIDENT_UPLIFT_FORECAST_DAYS - 1)).isoformat(),
         }
 
+    # Сводка дня переписывается и при загрузке, и при пересчёте его прогноза,
+    # поэтому её updated_at покрывает и факт, и forecast_calls исходных дней.
+    cache_key = _forecast_cache_key("incident", {"lookback_days": lookback_days})
+    watermark = _forecast_watermark(source_rows)
+    cached = _load_forecast_cache_tx(cursor, "incident", [as_of_date], cache_key).get(as_of_date)
+    if cached is not None and cached[0] == watermark:
+        return cached[1]
+    uplift = _build_recent_incident_uplift_profile_tx(cursor, as_of_date, source_dates, lookback_days)
+    _save_forecast_cache_tx(cursor, "incident", cache_key, [(as_of_date, watermark, uplift)])
+    return uplift
+
+
+def _build_recent_incident_uplift_profile_tx(
+    cursor,
+    as_of_date,
+    source_dates: List[Any],
+    lookback_days: int,
+) -> Dict[str, Any]:
     weights_by_date = {
         report_date: lookback_days - index
         for index, report_date in enumerate(source_dates)
@@ -888,7 +1043,15 @@ def _build_week_forecast_payload(
 
 
 def _compute_historical_forecast_profile_for_day_tx(cursor, report_date, settings: Dict[str, Any]) -> Dict[str, Any]:
-    return _compute_forecast_profile_for_date_tx(cursor, report_date, settings)
+    return _compute_forecast_profiles_for_dates_tx(cursor, [report_date], settings)[0]
+
+
+def _forecast_dates_affected_by_history(changed_dates: List[Any]) -> List[Any]:
+    return sorted({
+        changed_date + timedelta(days=offset)
+        for changed_date in changed_dates
+        for offset in (0, *FORECAST_HISTORY_OFFSETS_DAYS)
+    })
 
 
 def _period_totals(
@@ -0,0 +1,183 @@
+"""Worker processes for the shift preview strategy portfolio.
+
+The greedy strategies are pure Python and serialize on the GIL when run in threads, so
+the independent strategies of one preview run in separate processes. multiprocessing
+does not fit the web process: spawn and forkserver both re-execute ``__main__`` in every
+worker (that is the whole bot_schedule2.py), and fork of a multithreaded process is
+unsafe. A worker here is a plain ``python -m resource_fte.preview_pool <module>``
+interpreter that imports only the strategy module and answers length-prefixed pickle
+frames ``(function name, args, kwargs)`` on its stdin/stdout. Workers outlive a call, so
+the numpy/ortools import is paid once per worker, not per solve.
+"""
+import importlib
+import os
+import pickle
+import struct
+import subprocess
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+_FRAME_HEADER = struct.Struct("!Q")
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_WORKER_EXIT_TIMEOUT_SECONDS = 5
+
+Call = Tuple[str, Sequence[Any], Dict[str, Any]]
+
+
+class PreviewWorkerError(RuntimeError):
+    """A worker process could not be started or died in the middle of a call."""
+
+
+def _write_frame(stream, payload: Any) -> None:
+    data = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(_FRAME_HEADER.pack(len(data)))
+    stream.write(data)
+    stream.flush()
+
+
+def _read_frame(stream) -> Any:
+    header = stream.read(_FRAME_HEADER.size)
+    if len(header) < _FRAME_HEADER.size:
+        raise EOFError("preview worker stream closed")
+    (size,) = _FRAME_HEADER.unpack(header)
+    data = stream.read(size)
+    if len(data) < size:
+        raise EOFError("preview worker stream closed mid-frame")
+    return pickle.loads(data)
+
+
+class _Worker:
+    def __init__(self, module: str):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, (_PROJECT_ROOT, env.get("PYTHONPATH"))))
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, "-m", __name__, module],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                cwd=_PROJECT_ROOT,
+                env=env,
+            )
+        except OSError as exc:
+            raise PreviewWorkerError(f"cannot start preview worker: {exc}") from exc
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def call(self, name: str, args: Sequence[Any], kwargs: Dict[str, Any]) -> Any:
+        try:
+            _write_frame(self.process.stdin, (name, tuple(args), dict(kwargs)))
+            ok, value = _read_frame(self.process.stdout)
+        except (EOFError, OSError, pickle.UnpicklingError) as exc:
+            self.close()
+            raise PreviewWorkerError(
+                f"preview worker exited during {name} (code {self.process.poll()})"
+            ) from exc
+        if not ok:
+            raise value
+        return value
+
+    def close(self) -> None:
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        try:
+            self.process.wait(timeout=_WORKER_EXIT_TIMEOUT_SECONDS)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class PreviewProcessPool:
+    """At most `size` worker processes running functions of `module` by name.
+
+    `map` keeps the call order of its results. A worker serves one call at a time; idle
+    workers are reused, and a worker that died is replaced on the next call.
+    """
+
+    def __init__(self, module: str, size: int):
+        self.module = module
+        self.size = max(1, int(size))
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle: List[_Worker] = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _acquire(self) -> _Worker:
+        self._slots.acquire()
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive:
+                    return worker
+        try:
+            return _Worker(self.module)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, worker: _Worker) -> None:
+        keep = False
+        with self._lock:
+            if worker.alive and not self._closed:
+                self._idle.append(worker)
+                keep = True
+        if not keep:
+            worker.close()
+        self._slots.release()
+
+    def call(self, name: str, args: Sequence[Any] = (), kwargs: Optional[Dict[str, Any]] = None) -> Any:
+        worker = self._acquire()
+        try:
+            return worker.call(name, args, kwargs or {})
+        finally:
+            self._release(worker)
+
+    def map(self, calls: Sequence[Call]) -> List[Any]:
+        if len(calls) <= 1:
+            return [self.call(*call) for call in calls]
+        # Dispatch threads only wait on pipes; the work happens in the worker processes.
+        with ThreadPoolExecutor(
+            max_workers=min(len(calls), self.size), thread_name_prefix="shift-preview-pool",
+        ) as dispatch:
+            futures = [dispatch.submit(self.call, *call) for call in calls]
+            return [future.result() for future in futures]
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.close()
+
+
+def _serve(module_name: str) -> None:
+    # Frames own the real stdout; anything a strategy prints goes to stderr instead.
+    frames_out = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    frames_in = sys.stdin.buffer
+    module = importlib.import_module(module_name)
+    while True:
+        try:
+            name, args, kwargs = _read_frame(frames_in)
+        except EOFError:
+            return
+        try:
+            reply = (True, getattr(module, name)(*args, **kwargs))
+        except Exception as exc:
+            reply = (False, exc)
+        try:
+            _write_frame(frames_out, reply)
+        except Exception:
+            _write_frame(frames_out, (False, PreviewWorkerError(traceback.format_exc())))
+
+
+if __name__ == "__main__":
+    _serve(sys.argv[1])
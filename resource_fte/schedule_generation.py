@@ -1,8 +1,18 @@
+import atexit
+import copy
+import hashlib
+import json
+import logging
 import math
 import re
-from collections import Counter, defaultdict
-from typing import Any, Dict, List, Optional
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
+import numpy as np
+
+from . import preview_pool
 from .common import _resource_rate_key, _resource_rate_value, _round_fte_to_half, _to_float, _to_int
 
 try:
@@ -88,6 +98,20 @@ SHIFT_PREVIEW_DEEP_NIGHT_NEED_WEIGHT = 3.5
 SHIFT_PREVIEW_CP_SAT_TIME_LIMIT_SECONDS = 4.0
 SHIFT_PREVIEW_CP_SAT_MIN_OVER_TIME_LIMIT_SECONDS = 20.0
 SHIFT_PREVIEW_CP_SAT_SEARCH_WORKERS = 8
+# Independent strategies of one preview run in a pool of worker processes (preview_pool.py);
+# 1 runs them one after another in-process. SHIFT_PREVIEW_CP_SAT_SEARCH_WORKERS is the budget
+# for the whole host: the pool never holds more processes than the budget, and every solve
+# gets budget // pool size search workers, so concurrent solves x workers stays within it.
+SHIFT_PREVIEW_PROCESS_WORKERS = 4
+# The template and freeform selections of one preview are dispatched side by side.
+SHIFT_PREVIEW_PARALLEL_WORKERS = 2
+# The first CP-SAT stage runs once per seed; 0 is the solver default the single run used.
+SHIFT_PREVIEW_CP_SAT_PORTFOLIO_SEEDS = (0, 1, 2)
+SHIFT_PREVIEW_CP_SAT_MIN_OVER_SEED = 0
+SHIFT_PREVIEW_CP_SAT_FIXED_MIX_REFINE_SEED = 23
+# Selections are cached in-process by content (target, rate capacity, candidate templates,
+# carry-in coverage): re-opening the same period's preview does not re-run the solvers.
+SHIFT_PREVIEW_RESULT_CACHE_MAX_ENTRIES = 32
 SHIFT_PREVIEW_CP_SAT_MIN_OVER_MAX_CANDIDATES = 1200
 SHIFT_PREVIEW_CP_SAT_SCALE = 240
 SHIFT_PREVIEW_CP_SAT_FIXED_MIX_REFINE_TIME_LIMIT_SECONDS = 6.0
@@ -506,27 +530,43 @@ def _shift_preview_usage_state(
         _resource_rate_key(rate): [0.0 for _ in range(total_hours)]
         for rate in RESOURCE_RATE_VALUES
     }
-    for item in selected or []:
-        template = item.get("template") or {}
-        rate_key = _resource_rate_key(template.get("rate"))
-        day_index = int(item.get("dayIndex") or 0)
-        weekly_usage[rate_key] += 1
-        daily_usage[day_index][rate_key] += 1
-        presence_vector = item.get("presenceVector")
-        if presence_vector is None:
-            presence_vector = _shift_preview_presence_vector(day_index, template, total_hours)
-        for index, amount in enumerate(presence_vector or []):
-            if index >= total_hours:
-                break
-            hourly_usage[rate_key][index] = round(
-                float(hourly_usage[rate_key][index] or 0) + float(amount or 0),
-                4,
-            )
-    return {
+    usage_state = {
         "weekly_usage": weekly_usage,
         "daily_usage": daily_usage,
         "hourly_usage": hourly_usage,
     }
+    for item in selected or []:
+        _shift_preview_usage_state_add(usage_state, item, total_hours)
+    return usage_state
+
+
+def _shift_preview_usage_state_add(
+    usage_state: Dict[str, Any],
+    item: Dict[str, Any],
+    total_hours: int,
+) -> None:
+    """Account one more selected shift; appending in order gives exactly the state a full
+    rebuild would, so the add loop can update usage instead of recounting every shift."""
+    total_hours = max(24, int(total_hours or SHIFT_PREVIEW_HOURS))
+    hourly_usage = usage_state["hourly_usage"]
+    template = item.get("template") or {}
+    rate_key = _resource_rate_key(template.get("rate"))
+    day_index = int(item.get("dayIndex") or 0)
+    usage_state["weekly_usage"][rate_key] += 1
+    usage_state["daily_usage"][day_index][rate_key] += 1
+    presence_vector = item.get("presenceVector")
+    if presence_vector is None:
+        presence_vector = _shift_preview_presence_vector(day_index, template, total_hours)
+    for index, amount in enumerate(presence_vector or []):
+        if index >= total_hours:
+            break
+        if not amount:
+            # Usage values are already rounded, so adding zero would leave them unchanged.
+            continue
+        hourly_usage[rate_key][index] = round(
+            float(hourly_usage[rate_key][index] or 0) + float(amount or 0),
+            4,
+        )
 
 
 def _shift_preview_presence_vector(day_index: int, template: Dict[str, Any], total_hours: int = SHIFT_PREVIEW_HOURS) -> List[float]:
@@ -1051,6 +1091,54 @@ def _select_best_shift_preview_result(
     return min(strategy_results, key=lambda item: _shift_preview_result_rank(item, deficit_limit))
 
 
+def _round_fte_to_half_array(values: "np.ndarray") -> "np.ndarray":
+    # Same arithmetic as _round_fte_to_half; the result is already a multiple of the step,
+    # so its final round(..., 4) never changes the value.
+    return np.floor(np.maximum(values, 0.0) / FTE_ROUNDING_STEP + 0.5) * FTE_ROUNDING_STEP
+
+
+def _shift_preview_prune_totals(
+    target: List[float],
+    coverage: List[float],
+    active_by_item: List[List[tuple]],
+) -> List[Dict[str, float]]:
+    """Deficit, over and real coverage of `coverage` minus each selected shift, for the whole
+    selection at once.
+
+    Only the shift's own hours are re-rounded in Python. Per-hour terms are built with numpy
+    and reduced with the builtin sum over the same values in the same order, so each figure
+    equals the one _shift_preview_totals would give for that shift's coverage_without.
+    """
+    total_hours = len(target)
+    if not active_by_item:
+        return []
+    target_array = np.array([float(item or 0) for item in target])
+    real_needed = sum(float(item or 0) for item in target)
+    without = np.tile(
+        np.array([round(float(coverage[index] or 0), 4) for index in range(total_hours)]),
+        (len(active_by_item), 1),
+    )
+    for row, active_items in enumerate(active_by_item):
+        for index, amount in active_items:
+            without[row, index] = round(float(coverage[index] or 0) - amount, 4)
+    rounded = _round_fte_to_half_array(without)
+    totals = []
+    for deficit_row, over_row, covered_row in zip(
+        np.maximum(0.0, target_array - rounded).tolist(),
+        np.maximum(0.0, rounded - target_array).tolist(),
+        np.minimum(without, target_array).tolist(),
+    ):
+        real_covered_need = sum(covered_row)
+        totals.append({
+            "deficitFteHours": round(sum(deficit_row), 4),
+            "overFteHours": round(sum(over_row), 4),
+            "realCoveragePercent": round(
+                (real_covered_need / real_needed * 100) if real_needed > 0 else 0.0, 2
+            ),
+        })
+    return totals
+
+
 def _shift_preview_prune_selected(
     target: List[float],
     coverage: List[float],
@@ -1061,17 +1149,19 @@ def _shift_preview_prune_selected(
     selected = list(selected)
     coverage = list(coverage)
     limit = float(deficit_limit) if deficit_limit is not None else None
+    active_by_item = [
+        [
+            (index, float(selected_item["vector"][index] or 0))
+            for index in range(len(target))
+            if float(selected_item["vector"][index] or 0)
+        ]
+        for selected_item in selected
+    ]
     while True:
         current_totals = _shift_preview_totals(target, coverage)
         current_quality = _shift_preview_quality_score(current_totals, len(selected))
         removed = False
-        for item_index, selected_item in enumerate(list(selected)):
-            vector = selected_item["vector"]
-            coverage_without = [
-                round(float(coverage[index] or 0) - float(vector[index] or 0), 4)
-                for index in range(len(target))
-            ]
-            next_totals = _shift_preview_totals(target, coverage_without)
+        for item_index, next_totals in enumerate(_shift_preview_prune_totals(target, coverage, active_by_item)):
             if prune_mode == "objective":
                 next_quality = _shift_preview_quality_score(next_totals, len(selected) - 1)
                 should_remove = next_quality + 0.001 < current_quality
@@ -1097,8 +1187,12 @@ def _shift_preview_prune_selected(
                 )
             if not should_remove:
                 continue
-            selected.pop(item_index)
-            coverage = coverage_without
+            vector = selected.pop(item_index)["vector"]
+            active_by_item.pop(item_index)
+            coverage = [
+                round(float(coverage[index] or 0) - float(vector[index] or 0), 4)
+                for index in range(len(target))
+            ]
             removed = True
             break
         if not removed:
@@ -1185,7 +1279,7 @@ def _shift_preview_can_add_candidate(
     if active_capacity <= 0:
         return False
     if removed_matches_rate:
-        # Hot path: callers in improve_selected precompute this once per removed_item.
+        # Callers checking many candidates against one removed_item may precompute this.
         # Falling back to a full scan keeps the function safe for ad-hoc callers.
         removed_presence = (
             removed_item.get("_presenceByHour")
@@ -1215,6 +1309,220 @@ def _shift_preview_selected_active_items(selected_item: Dict[str, Any]) -> List[
     return items
 
 
+def _shift_preview_candidate_matrix(
+    candidates: List[Dict[str, Any]],
+    rate_capacity: Dict[str, Dict[str, Any]],
+    total_hours: int,
+) -> Dict[str, Any]:
+    """Pack candidates into arrays (candidates x hours) for the batched local-search kernels.
+
+    Amounts come from the same activeVector / activePresenceVector items the scalar helpers
+    iterate, so both paths see identical numbers. Besides the dense rows every candidate gets
+    a window: the columns from its first active hour on, wide enough for the longest shift.
+    Scores over the window cost ~width instead of ~total_hours per candidate.
+    """
+    count = len(candidates)
+    vector = np.zeros((count, total_hours))
+    presence = np.zeros((count, total_hours))
+    in_range = np.ones(count, dtype=bool)
+    first_hour = np.zeros(count, dtype=np.int64)
+    width = 1
+    rate_keys: List[str] = []
+    rate_positions: Dict[str, int] = {}
+    rate_index = np.zeros(count, dtype=np.int64)
+    day_index = np.zeros(count, dtype=np.int64)
+    preference = np.zeros(count)
+    template_ids = []
+    for row, candidate in enumerate(candidates):
+        rate_key = candidate["rateKey"]
+        if rate_key not in rate_positions:
+            rate_positions[rate_key] = len(rate_keys)
+            rate_keys.append(rate_key)
+        rate_index[row] = rate_positions[rate_key]
+        day_index[row] = int(candidate.get("dayIndex") or 0)
+        preference[row] = float(candidate.get("preferenceScore") or 0)
+        template_ids.append(str((candidate.get("template") or {}).get("id") or ""))
+        hours = []
+        for index, amount in candidate.get("activeVector") or _shift_preview_active_items(candidate["vector"]):
+            if 0 <= index < total_hours:
+                vector[row, index] = float(amount or 0)
+                hours.append(index)
+        for index, amount in candidate.get("activePresenceVector") or []:
+            if index >= total_hours:
+                in_range[row] = False
+                continue
+            presence[row, index] = float(amount or 0)
+            hours.append(index)
+        if hours:
+            first_hour[row] = min(hours)
+            width = max(width, max(hours) - min(hours) + 1)
+    window_hours = first_hour[:, None] + np.arange(width)[None, :]
+    window_valid = window_hours < total_hours
+    window_hours = np.minimum(window_hours, total_hours - 1)
+    rows = np.arange(count)[:, None]
+    capacities = [rate_capacity.get(rate_key) or {} for rate_key in rate_keys]
+    return {
+        "total_hours": total_hours,
+        "vector": vector,
+        "presence": presence,
+        "in_range": in_range,
+        "window_hours": window_hours,
+        "window_vector": np.where(window_valid, vector[rows, window_hours], 0.0),
+        "window_presence": np.where(window_valid, presence[rows, window_hours], 0.0),
+        "rate_keys": rate_keys,
+        "rate_positions": rate_positions,
+        "rate_index": rate_index,
+        "day_index": day_index,
+        "day_count": int(day_index.max()) + 1 if count else 1,
+        "preference": preference,
+        "template_ids": np.array(template_ids, dtype=object),
+        "weekly_capacity": np.array(
+            [int(capacity.get("weekly_shift_capacity") or 0) for capacity in capacities], dtype=np.int64
+        ),
+        "daily_capacity": np.array(
+            [int(capacity.get("daily_shift_capacity") or 0) for capacity in capacities], dtype=np.int64
+        ),
+        "need_weight": np.array([_shift_preview_need_weight(index) for index in range(total_hours)]),
+    }
+
+
+def _shift_preview_usage_arrays(usage_state: Dict[str, Any], matrix: Dict[str, Any]) -> Dict[str, Any]:
+    """Project a usage state onto the matrix rate order."""
+    rate_keys = matrix["rate_keys"]
+    total_hours = matrix["total_hours"]
+    daily_usage = usage_state["daily_usage"]
+    hourly = np.zeros((len(rate_keys), total_hours))
+    for position, rate_key in enumerate(rate_keys):
+        values = usage_state["hourly_usage"].get(rate_key) or []
+        hourly[position, :min(total_hours, len(values))] = values[:total_hours]
+    return {
+        "weekly": np.array(
+            [int(usage_state["weekly_usage"][rate_key] or 0) for rate_key in rate_keys], dtype=np.int64
+        ),
+        "daily": np.array(
+            [
+                [int(daily_usage[day][rate_key] or 0) for rate_key in rate_keys]
+                for day in range(matrix["day_count"])
+            ],
+            dtype=np.int64,
+        ).reshape(matrix["day_count"], len(rate_keys)),
+        "hourly": hourly,
+    }
+
+
+def _shift_preview_selected_presence_array(item: Dict[str, Any], total_hours: int) -> "np.ndarray":
+    presence = np.zeros(total_hours)
+    for index, amount in _shift_preview_selected_presence_by_hour(item).items():
+        if index < total_hours:
+            presence[index] = amount
+    return presence
+
+
+def _shift_preview_batch_can_add(
+    matrix: Dict[str, Any],
+    rows: "np.ndarray",
+    usage: Dict[str, Any],
+    removed_item: Optional[Dict[str, Any]] = None,
+) -> "np.ndarray":
+    """Vectorized _shift_preview_can_add_candidate for the candidate rows `rows`."""
+    rate = matrix["rate_index"][rows]
+    day = matrix["day_index"][rows]
+    weekly = usage["weekly"][rate]
+    daily = usage["daily"][day, rate]
+    hourly = usage["hourly"][rate[:, None], matrix["window_hours"][rows]]
+    if removed_item is not None:
+        removed_rate = matrix["rate_positions"].get(
+            _resource_rate_key((removed_item.get("template") or {}).get("rate")), -1
+        )
+        same_rate = rate == removed_rate
+        weekly = weekly - same_rate
+        daily = daily - (same_rate & (day == int(removed_item.get("dayIndex") or 0)))
+        removed_presence = removed_item.get("_presenceArray")
+        if removed_presence is None:
+            removed_presence = _shift_preview_selected_presence_array(removed_item, matrix["total_hours"])
+        hourly = np.where(
+            same_rate[:, None],
+            hourly - removed_presence[matrix["window_hours"][rows]],
+            hourly,
+        )
+    daily_capacity = matrix["daily_capacity"][rate]
+    presence = matrix["window_presence"][rows]
+    over_capacity = (presence > 0) & (hourly + presence > daily_capacity[:, None] + 0.001)
+    return (
+        matrix["in_range"][rows]
+        & (weekly < matrix["weekly_capacity"][rate])
+        & (daily < daily_capacity)
+        & (daily_capacity > 0)
+        & ~over_capacity.any(axis=1)
+    )
+
+
+def _shift_preview_batch_score(
+    target: "np.ndarray",
+    coverage: "np.ndarray",
+    matrix: Dict[str, Any],
+    rows: "np.ndarray",
+    strategy: Optional[Dict[str, Any]] = None,
+) -> Dict[str, "np.ndarray"]:
+    """Vectorized _shift_preview_score for the candidate rows `rows`.
+
+    Per-hour terms use the scalar expressions in the same association order and are summed
+    left to right (cumsum, not the pairwise np.sum), so every score is bit-identical to the
+    scalar one and greedy tie-breaking cannot drift.
+    """
+    strategy = strategy or SHIFT_PREVIEW_GREEDY_STRATEGIES[0]
+    hours = matrix["window_hours"][rows]
+    amount = matrix["window_vector"][rows]
+    need = target[hours]
+    current = coverage[hours]
+    closed = np.maximum(0.0, need - current) - np.maximum(0.0, need - current - amount)
+    added_over = np.maximum(0.0, np.maximum(0.0, current + amount - need) - np.maximum(0.0, current - need))
+    weighted_need = closed * (1.0 + np.minimum(need, 10.0) * 0.04) * matrix["need_weight"][hours]
+
+    def _row_sums(values: "np.ndarray") -> "np.ndarray":
+        if values.shape[1] == 0:
+            return np.zeros(values.shape[0])
+        return np.cumsum(values, axis=1)[:, -1]
+
+    weighted_total = _row_sums(weighted_need)
+    added_over_total = _row_sums(added_over)
+    active_total = _row_sums(amount)
+    return {
+        "score": (
+            weighted_total * float(strategy.get("need_weight", 10.0))
+            - added_over_total * float(strategy.get("over_weight", 3.2))
+            - active_total * float(strategy.get("active_weight", 0.015))
+        ),
+        "covered_need": _row_sums(closed),
+        "added_over": added_over_total,
+        "active": active_total,
+    }
+
+
+def _shift_preview_batch_move_delta(
+    target: "np.ndarray",
+    coverage: "np.ndarray",
+    hours: "np.ndarray",
+    change: "np.ndarray",
+) -> Dict[str, "np.ndarray"]:
+    """Vectorized deficit / over deltas of _shift_preview_local_move_delta: `change[i, j]` is the
+    net coverage change of move i at hour `hours[..., j]`. Untouched hours contribute zero."""
+    needed = target[hours]
+    old_real = coverage[hours]
+    new_real = old_real + change
+    new_real = np.where(new_real < 0, 0.0, new_real)
+    old_rounded = _round_fte_to_half_array(old_real)
+    new_rounded = _round_fte_to_half_array(new_real)
+    return {
+        "deficit": (
+            np.maximum(0.0, needed - new_rounded) - np.maximum(0.0, needed - old_rounded)
+        ).sum(axis=-1),
+        "over": (
+            np.maximum(0.0, new_rounded - needed) - np.maximum(0.0, old_rounded - needed)
+        ).sum(axis=-1),
+    }
+
+
 def _shift_preview_improve_selected(
     target: List[float],
     coverage: List[float],
@@ -1247,11 +1555,6 @@ def _shift_preview_improve_selected(
     def _rank_now(selected_count: int) -> tuple:
         return _make_rank(components["deficit"], components["over"], selected_count)
 
-    def _rank_with_delta(delta: Dict[str, float], selected_delta: int, selected_count_now: int) -> tuple:
-        next_deficit = components["deficit"] + delta["deficit"]
-        next_over = components["over"] + delta["over"]
-        return _make_rank(next_deficit, next_over, selected_count_now + selected_delta)
-
     def _accept(new_rank: tuple, current_rank: tuple) -> bool:
         # Tight lexicographic improvement; the epsilon prevents oscillation on
         # rounding noise of equal-quality moves.
@@ -1269,25 +1572,39 @@ def _shift_preview_improve_selected(
             return True
         return False
 
+    # Feasibility and deficit / over deltas of a whole neighbourhood are computed at once on
+    # the candidate matrix; the sequential _accept scan below then sees the same deltas in the
+    # same order as a per-candidate evaluation, so the chosen moves do not change.
+    matrix = _shift_preview_candidate_matrix(candidates, rate_capacity, total_hours)
+    target_array = np.array([float(item or 0) for item in target])
+    all_rows = np.arange(len(candidates))
+    usage_state = _shift_preview_usage_state(selected, total_hours)
     for _ in range(max(0, int(SHIFT_PREVIEW_LOCAL_ADD_MAX_ITERATIONS))):
-        usage_state = _shift_preview_usage_state(selected, total_hours)
         current_rank = _rank_now(len(selected))
         best_candidate = None
-        best_delta = None
         best_rank = current_rank
-        for candidate in candidates:
-            if not _shift_preview_can_add_candidate(candidate, usage_state, rate_capacity, total_hours):
-                continue
-            add_items = candidate.get("activeVector") or _shift_preview_active_items(candidate["vector"])
-            delta = _shift_preview_local_move_delta(target, coverage, add_items, None)
-            new_rank = _rank_with_delta(delta, 1, len(selected))
+        feasible_rows = all_rows[
+            _shift_preview_batch_can_add(matrix, all_rows, _shift_preview_usage_arrays(usage_state, matrix))
+        ]
+        batch_delta = _shift_preview_batch_move_delta(
+            target_array,
+            np.array([float(item or 0) for item in coverage]),
+            matrix["window_hours"][feasible_rows],
+            matrix["window_vector"][feasible_rows],
+        )
+        for row, deficit_delta, over_delta in zip(
+            feasible_rows.tolist(), batch_delta["deficit"].tolist(), batch_delta["over"].tolist()
+        ):
+            new_rank = _make_rank(
+                components["deficit"] + deficit_delta, components["over"] + over_delta, len(selected) + 1
+            )
             if _accept(new_rank, best_rank):
-                best_candidate = candidate
-                best_delta = delta
+                best_candidate = candidates[row]
                 best_rank = new_rank
         if best_candidate is None:
             break
         add_items = best_candidate.get("activeVector") or _shift_preview_active_items(best_candidate["vector"])
+        best_delta = _shift_preview_local_move_delta(target, coverage, add_items, None)
         _shift_preview_apply_active_delta(coverage, add_items, None)
         components["deficit"] += best_delta["deficit"]
         components["over"] += best_delta["over"]
@@ -1295,6 +1612,7 @@ def _shift_preview_improve_selected(
         chosen = _shift_preview_candidate_to_selected(best_candidate)
         chosen["_activeVector"] = list(add_items)
         selected.append(chosen)
+        _shift_preview_usage_state_add(usage_state, chosen, total_hours)
 
     candidates_by_rate = defaultdict(list)
     for candidate in candidates:
@@ -1302,9 +1620,10 @@ def _shift_preview_improve_selected(
 
     mix_counts = _shift_preview_rate_mix_counts(rate_capacity)
     enforce_rate_mix = sum(mix_counts.values()) > 0
-    candidates_by_day = defaultdict(list)
-    for candidate in candidates:
-        candidates_by_day[int(candidate.get("dayIndex") or 0)].append(candidate)
+    rows_by_day = defaultdict(list)
+    for row, candidate in enumerate(candidates):
+        rows_by_day[int(candidate.get("dayIndex") or 0)].append(row)
+    rows_by_day = {day: np.array(rows, dtype=np.int64) for day, rows in rows_by_day.items()}
 
     for _ in range(max(0, int(SHIFT_PREVIEW_LOCAL_SWAP_MAX_ITERATIONS))):
         usage_state = _shift_preview_usage_state(selected, total_hours)
@@ -1316,52 +1635,75 @@ def _shift_preview_improve_selected(
         )
         current_rank = _rank_now(len(selected))
         best_move = None
-        best_delta = None
         best_rank = current_rank
+        usage = _shift_preview_usage_arrays(usage_state, matrix)
+        coverage_array = np.array([float(item or 0) for item in coverage])
+        next_mix_deviation_by_pair: Dict[tuple, float] = {}
         for selected_item in selected:
-            if "_presenceByHour" not in selected_item:
-                selected_item["_presenceByHour"] = _shift_preview_selected_presence_by_hour(selected_item)
+            if "_presenceArray" not in selected_item:
+                selected_item["_presenceArray"] = _shift_preview_selected_presence_array(selected_item, total_hours)
         for remove_index, selected_item in enumerate(selected):
             removed_items = _shift_preview_selected_active_items(selected_item)
             selected_rate_key = _resource_rate_key((selected_item.get("template") or {}).get("rate"))
             selected_day = int(selected_item.get("dayIndex") or 0)
             # Coverage is independent per day, so cross-day swaps are virtually never
             # productive but blow up the inner loop ~7x for a week.
-            for candidate in candidates_by_day.get(selected_day, []):
-                if _shift_preview_is_same_candidate(selected_item, candidate):
-                    continue
-                candidate_rate_key = candidate["rateKey"]
-                if enforce_rate_mix and candidate_rate_key != selected_rate_key:
-                    next_weekly_usage = dict(weekly_usage)
-                    next_weekly_usage[selected_rate_key] = max(
-                        0, int(next_weekly_usage.get(selected_rate_key) or 0) - 1
-                    )
-                    next_weekly_usage[candidate_rate_key] = (
-                        int(next_weekly_usage.get(candidate_rate_key) or 0) + 1
-                    )
-                    next_mix_deviation = _shift_preview_rate_mix_deviation(
-                        next_weekly_usage, rate_capacity
-                    )
-                    if next_mix_deviation > current_mix_deviation + 0.0001:
+            day_rows = rows_by_day.get(selected_day)
+            if day_rows is None:
+                continue
+            selected_template_id = str((selected_item.get("template") or {}).get("id") or "")
+            day_rows = day_rows[matrix["template_ids"][day_rows] != selected_template_id]
+            if enforce_rate_mix:
+                allowed_rates = []
+                for candidate_rate_key in matrix["rate_keys"]:
+                    if candidate_rate_key == selected_rate_key:
+                        allowed_rates.append(True)
                         continue
-                if not _shift_preview_can_add_candidate(
-                    candidate,
-                    usage_state,
-                    rate_capacity,
-                    total_hours,
-                    removed_item=selected_item,
-                ):
-                    continue
-                add_items = candidate.get("activeVector") or _shift_preview_active_items(candidate["vector"])
-                delta = _shift_preview_local_move_delta(target, coverage, add_items, removed_items)
-                new_rank = _rank_with_delta(delta, 0, len(selected))
+                    pair = (selected_rate_key, candidate_rate_key)
+                    if pair not in next_mix_deviation_by_pair:
+                        next_weekly_usage = dict(weekly_usage)
+                        next_weekly_usage[selected_rate_key] = max(
+                            0, int(next_weekly_usage.get(selected_rate_key) or 0) - 1
+                        )
+                        next_weekly_usage[candidate_rate_key] = (
+                            int(next_weekly_usage.get(candidate_rate_key) or 0) + 1
+                        )
+                        next_mix_deviation_by_pair[pair] = _shift_preview_rate_mix_deviation(
+                            next_weekly_usage, rate_capacity
+                        )
+                    allowed_rates.append(next_mix_deviation_by_pair[pair] <= current_mix_deviation + 0.0001)
+                day_rows = day_rows[np.array(allowed_rates, dtype=bool)[matrix["rate_index"][day_rows]]]
+            day_rows = day_rows[_shift_preview_batch_can_add(matrix, day_rows, usage, removed_item=selected_item)]
+            if not len(day_rows):
+                continue
+            removed_vector = np.zeros(total_hours)
+            for index, amount in removed_items:
+                if amount and index < total_hours:
+                    removed_vector[index] += float(amount)
+            touched = np.flatnonzero(removed_vector)
+            window = matrix["window_hours"][day_rows]
+            span_start = int(min(window.min(), touched.min() if len(touched) else total_hours))
+            span_end = int(max(window.max(), touched.max() if len(touched) else -1)) + 1
+            batch_delta = _shift_preview_batch_move_delta(
+                target_array,
+                coverage_array,
+                np.arange(span_start, span_end),
+                matrix["vector"][day_rows, span_start:span_end] - removed_vector[span_start:span_end],
+            )
+            for row, deficit_delta, over_delta in zip(
+                day_rows.tolist(), batch_delta["deficit"].tolist(), batch_delta["over"].tolist()
+            ):
+                new_rank = _make_rank(
+                    components["deficit"] + deficit_delta, components["over"] + over_delta, len(selected)
+                )
                 if _accept(new_rank, best_rank):
-                    best_move = (remove_index, candidate, add_items, removed_items)
-                    best_delta = delta
+                    best_move = (remove_index, candidates[row], removed_items)
                     best_rank = new_rank
         if best_move is None:
             break
-        remove_index, candidate, add_items, removed_items = best_move
+        remove_index, candidate, removed_items = best_move
+        add_items = candidate.get("activeVector") or _shift_preview_active_items(candidate["vector"])
+        best_delta = _shift_preview_local_move_delta(target, coverage, add_items, removed_items)
         _shift_preview_apply_active_delta(coverage, add_items, removed_items)
         components["deficit"] += best_delta["deficit"]
         components["over"] += best_delta["over"]
@@ -1372,7 +1714,7 @@ def _shift_preview_improve_selected(
 
     for item in selected:
         item.pop("_activeVector", None)
-        item.pop("_presenceByHour", None)
+        item.pop("_presenceArray", None)
     if limit is not None:
         # Final rank-aware prune: trade a sliver of deficit (still inside the budget)
         # for lower over. The swap loop above cannot do this on its own because it
@@ -1427,6 +1769,13 @@ def _run_shift_preview_greedy_strategy(
         candidates_by_rate[candidate["rateKey"]].append(candidate)
     mix_counts = _shift_preview_rate_mix_counts(rate_capacity)
     enforce_rate_mix = sum(mix_counts.values()) > 0
+    # Each step scores the whole candidate pool at once; see _shift_preview_batch_score.
+    matrix = _shift_preview_candidate_matrix(candidates, rate_capacity, total_hours)
+    target_array = np.array([float(item or 0) for item in target])
+    rows_by_rate = defaultdict(list)
+    for row, candidate in enumerate(candidates):
+        rows_by_rate[candidate["rateKey"]].append(row)
+    rows_by_rate = {rate_key: np.array(rows, dtype=np.int64) for rate_key, rows in rows_by_rate.items()}
 
     for _ in range(max_shifts):
         best = None
@@ -1452,71 +1801,80 @@ def _run_shift_preview_greedy_strategy(
                     for rate_key, value in next_mix_deviation_by_rate.items()
                     if abs(float(value or 0) - float(min_mix_deviation or 0)) <= 0.0001
                 ]
-        candidate_pool = [
-            candidate
+        pool_rows = [
+            rows_by_rate[rate_key]
             for rate_key in allowed_rate_keys
-            for candidate in candidates_by_rate.get(rate_key, [])
+            if rate_key in rows_by_rate
         ]
-        for candidate in candidate_pool:
-            rate_key = candidate["rateKey"]
-            day_index = int(candidate["dayIndex"])
-            capacity = rate_capacity.get(rate_key) or {}
-            if weekly_usage[rate_key] >= int(capacity.get("weekly_shift_capacity") or 0):
-                continue
-            if daily_usage[day_index][rate_key] >= int(capacity.get("daily_shift_capacity") or 0):
-                continue
-            active_capacity = int(capacity.get("daily_shift_capacity") or 0)
-            if active_capacity <= 0:
-                continue
-            if any(
-                float(hourly_usage[rate_key][index] or 0) + float(amount or 0) > active_capacity + 0.001
-                for index, amount in (candidate.get("activePresenceVector") or [])
-            ):
-                continue
-
-            stats = _shift_preview_score(
-                target,
-                coverage,
-                candidate["vector"],
-                strategy,
-                candidate.get("activeVector"),
-            )
-            if stats["covered_need"] <= min_covered_need:
-                continue
-            day_deficit = _shift_preview_day_deficit(target, coverage, day_index)
-            preference_score = float(candidate.get("preferenceScore") or 0)
-            current_mix_deviation = _shift_preview_rate_mix_deviation(weekly_usage, rate_capacity)
+        pool_rows = np.concatenate(pool_rows) if pool_rows else np.zeros(0, dtype=np.int64)
+        pool_rows = pool_rows[
+            _shift_preview_batch_can_add(matrix, pool_rows, _shift_preview_usage_arrays(usage_state, matrix))
+        ]
+        coverage_array = np.array([float(item or 0) for item in coverage])
+        batch = _shift_preview_batch_score(target_array, coverage_array, matrix, pool_rows, strategy)
+        keep = batch["covered_need"] > min_covered_need
+        pool_rows = pool_rows[keep]
+        batch = {key: values[keep] for key, values in batch.items()}
+        current_mix_deviation = _shift_preview_rate_mix_deviation(weekly_usage, rate_capacity)
+        day_deficit_by_day = {
+            day_index: _shift_preview_day_deficit(target, coverage, day_index)
+            for day_index in set(matrix["day_index"][pool_rows].tolist())
+        }
+        next_mix_deviation_by_position = []
+        for rate_key in matrix["rate_keys"]:
             next_mix_deviation = next_mix_deviation_by_rate.get(rate_key)
             if next_mix_deviation is None:
                 next_weekly_usage = dict(weekly_usage)
                 next_weekly_usage[rate_key] = int(next_weekly_usage.get(rate_key) or 0) + 1
                 next_mix_deviation = _shift_preview_rate_mix_deviation(next_weekly_usage, rate_capacity)
-            mix_delta = max(-20.0, min(20.0, current_mix_deviation - next_mix_deviation))
-            stats = {
-                **stats,
-                "day_deficit": round(day_deficit, 4),
-                "preference_score": round(preference_score, 4),
-                "mix_delta": round(mix_delta, 4),
-                "score": (
-                    stats["score"]
-                    + min(day_deficit, 120.0) * day_deficit_weight
-                    + preference_score
-                    + mix_delta * SHIFT_PREVIEW_GREEDY_RATE_MIX_WEIGHT
-                ),
-            }
-            if stats["score"] <= min_score:
-                continue
+            next_mix_deviation_by_position.append(next_mix_deviation)
+        pool_rates = matrix["rate_index"][pool_rows]
+        pool_day_deficit = np.array(
+            [day_deficit_by_day[day_index] for day_index in matrix["day_index"][pool_rows].tolist()]
+        )
+        pool_mix_delta = np.array([
+            max(-20.0, min(20.0, current_mix_deviation - next_mix_deviation))
+            for next_mix_deviation in next_mix_deviation_by_position
+        ])[pool_rates]
+        pool_preference = matrix["preference"][pool_rows]
+        pool_score = (
+            batch["score"]
+            + np.minimum(pool_day_deficit, 120.0) * day_deficit_weight
+            + pool_preference
+            + pool_mix_delta * SHIFT_PREVIEW_GREEDY_RATE_MIX_WEIGHT
+        )
+        keep = pool_score > min_score
+        if keep.any():
+            # Only rows that can tie the top two rank keys after round(..., 6) need the exact
+            # tuple comparison; the scan keeps pool order, so ties resolve as before.
+            mix_rank = np.array([
+                -round(float(next_mix_deviation or 0), 6)
+                for next_mix_deviation in next_mix_deviation_by_position
+            ])[pool_rates]
+            best_mix_rank = mix_rank[keep].max()
+            keep &= mix_rank == best_mix_rank
+            keep &= pool_score >= pool_score[keep].max() - 1e-5
+        for position in np.flatnonzero(keep).tolist():
+            preference_score = float(pool_preference[position])
             rank = (
-                -round(float(next_mix_deviation or 0), 6),
-                round(float(stats["score"] or 0), 6),
-                round(float(stats["covered_need"] or 0), 6),
+                -round(float(next_mix_deviation_by_position[int(pool_rates[position])] or 0), 6),
+                round(float(pool_score[position] or 0), 6),
+                round(float(batch["covered_need"][position] or 0), 6),
                 round(preference_score, 6),
-                -round(float(stats["added_over"] or 0), 6),
-                -round(float(stats["active"] or 0), 6),
+                -round(float(batch["added_over"][position] or 0), 6),
+                -round(float(batch["active"][position] or 0), 6),
             )
             if best_rank is None or rank > best_rank:
-                best = candidate
-                best_score = stats
+                best = candidates[int(pool_rows[position])]
+                best_score = {
+                    "score": float(pool_score[position]),
+                    "covered_need": float(batch["covered_need"][position]),
+                    "added_over": float(batch["added_over"][position]),
+                    "active": float(batch["active"][position]),
+                    "day_deficit": round(float(pool_day_deficit[position]), 4),
+                    "preference_score": round(preference_score, 4),
+                    "mix_delta": round(float(pool_mix_delta[position]), 4),
+                }
                 best_rank = rank
         if best is None:
             break
@@ -1571,11 +1929,131 @@ def _shift_preview_status_name(status: int) -> str:
     return status_names.get(status, str(status))
 
 
+def _shift_preview_pool_size() -> int:
+    return max(1, min(int(SHIFT_PREVIEW_PROCESS_WORKERS), int(SHIFT_PREVIEW_CP_SAT_SEARCH_WORKERS)))
+
+
+def _shift_preview_solve_search_workers() -> int:
+    """CP-SAT workers per solve: the whole budget in-process, an equal share of it per pool slot."""
+    return max(1, int(SHIFT_PREVIEW_CP_SAT_SEARCH_WORKERS) // _shift_preview_pool_size())
+
+
+def _shift_preview_search_workers(search_workers: Optional[int] = None) -> int:
+    if search_workers is None:
+        return SHIFT_PREVIEW_CP_SAT_SEARCH_WORKERS
+    return max(1, min(int(search_workers), SHIFT_PREVIEW_CP_SAT_SEARCH_WORKERS))
+
+
+_shift_preview_process_pool: Optional[preview_pool.PreviewProcessPool] = None
+_shift_preview_process_pool_lock = threading.Lock()
+
+
+def _shift_preview_pool() -> preview_pool.PreviewProcessPool:
+    global _shift_preview_process_pool
+    with _shift_preview_process_pool_lock:
+        if _shift_preview_process_pool is None:
+            _shift_preview_process_pool = preview_pool.PreviewProcessPool(__name__, _shift_preview_pool_size())
+            atexit.register(_shift_preview_process_pool.close)
+        return _shift_preview_process_pool
+
+
+def _shift_preview_run_strategies(calls: List[Tuple[str, tuple, Dict[str, Any]]]) -> List[Any]:
+    """Run independent strategy calls `(function name, args, kwargs)` in the process pool.
+
+    Results keep the call order, so ties between equally ranked strategies resolve exactly
+    as in a sequential run. Every CP-SAT call gets its share of the search-worker budget;
+    even a single call goes through the pool, so it counts against the pool's slots. If a
+    worker cannot be started or dies, the calls are run in-process instead: the preview is
+    slower, not lost.
+    """
+    search_workers = _shift_preview_solve_search_workers()
+    calls = [
+        (name, args, {**kwargs, "search_workers": search_workers})
+        if name.startswith("_run_shift_preview_cp_sat") else (name, args, kwargs)
+        for name, args, kwargs in calls
+    ]
+    if calls and _shift_preview_pool_size() > 1:
+        try:
+            return _shift_preview_pool().map(calls)
+        except preview_pool.PreviewWorkerError:
+            logging.exception("shift preview: worker pool failed, running strategies in-process")
+    return [globals()[name](*args, **kwargs) for name, args, kwargs in calls]
+
+
+def _shift_preview_run_parallel(calls: List[Callable[[], Any]]) -> List[Any]:
+    """Dispatch independent zero-argument calls from threads; results keep the call order.
+    Only for calls that hand their heavy work to the process pool."""
+    if len(calls) <= 1 or SHIFT_PREVIEW_PARALLEL_WORKERS <= 1 or _shift_preview_pool_size() <= 1:
+        return [call() for call in calls]
+    workers = min(len(calls), SHIFT_PREVIEW_PARALLEL_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shift-preview") as pool:
+        futures = [pool.submit(call) for call in calls]
+        return [future.result() for future in futures]
+
+
+_shift_preview_result_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_shift_preview_result_cache_lock = threading.Lock()
+
+
+def _shift_preview_result_cache_key(
+    target: List[float],
+    candidates: List[Dict[str, Any]],
+    rate_capacity: Dict[str, Dict[str, Any]],
+    initial_coverage: Optional[List[float]],
+    initial_selected: Optional[List[Dict[str, Any]]],
+    allow_cp_sat: bool,
+) -> str:
+    # Candidate vectors are a pure function of the template, the day and the period length,
+    # so the templates stand in for them and keep the key cheap to hash.
+    candidate_templates = [
+        (item.get("dayIndex"), item.get("rateKey"), item.get("source"), item.get("template"))
+        for item in candidates
+    ]
+    selected_templates = [
+        (item.get("dayIndex"), item.get("rateKey"), item.get("template"))
+        for item in (initial_selected or [])
+    ]
+    payload = json.dumps(
+        [target, rate_capacity, candidate_templates, initial_coverage or [], selected_templates, bool(allow_cp_sat)],
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _shift_preview_result_cache_get(key: str) -> Optional[Dict[str, Any]]:
+    with _shift_preview_result_cache_lock:
+        cached = _shift_preview_result_cache.get(key)
+        if cached is None:
+            return None
+        _shift_preview_result_cache.move_to_end(key)
+    return copy.deepcopy(cached)
+
+
+def _shift_preview_result_cache_put(key: str, result: Dict[str, Any]) -> None:
+    if SHIFT_PREVIEW_RESULT_CACHE_MAX_ENTRIES <= 0:
+        return
+    stored = copy.deepcopy(result)
+    with _shift_preview_result_cache_lock:
+        _shift_preview_result_cache[key] = stored
+        _shift_preview_result_cache.move_to_end(key)
+        while len(_shift_preview_result_cache) > SHIFT_PREVIEW_RESULT_CACHE_MAX_ENTRIES:
+            _shift_preview_result_cache.popitem(last=False)
+
+
+def clear_shift_preview_result_cache() -> None:
+    with _shift_preview_result_cache_lock:
+        _shift_preview_result_cache.clear()
+
+
 def _run_shift_preview_cp_sat_strategy(
     target: List[float],
     candidates: List[Dict[str, Any]],
     rate_capacity: Dict[str, Dict[str, Any]],
     initial_coverage: Optional[List[float]] = None,
+    random_seed: int = 0,
+    search_workers: Optional[int] = None,
 ) -> Optional[Dict[str, Any]]:
     if cp_model is None or not candidates or len(candidates) > SHIFT_PREVIEW_CP_SAT_MIN_OVER_MAX_CANDIDATES:
         return None
@@ -1694,7 +2172,8 @@ def _run_shift_preview_cp_sat_strategy(
 
     solver = cp_model.CpSolver()
     solver.parameters.max_time_in_seconds = SHIFT_PREVIEW_CP_SAT_TIME_LIMIT_SECONDS
-    solver.parameters.num_search_workers = SHIFT_PREVIEW_CP_SAT_SEARCH_WORKERS
+    solver.parameters.num_search_workers = _shift_preview_search_workers(search_workers)
+    solver.parameters.random_seed = int(random_seed)
     status = solver.Solve(model)
     if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
         return None
@@ -1755,6 +2234,7 @@ def _run_shift_preview_cp_sat_min_over_strategy(
     max_deficit_fte_hours: float,
     hint_selected: Optional[List[Dict[str, Any]]] = None,
     initial_coverage: Optional[List[float]] = None,
+    search_workers: Optional[int] = None,
 ) -> Optional[Dict[str, Any]]:
     if cp_model is None or not candidates or len(candidates) > SHIFT_PREVIEW_CP_SAT_MIN_OVER_MAX_CANDIDATES:
         return None
@@ -1861,7 +2341,8 @@ def _run_shift_preview_cp_sat_min_over_strategy(
 
     solver = cp_model.CpSolver()
     solver.parameters.max_time_in_seconds = SHIFT_PREVIEW_CP_SAT_MIN_OVER_TIME_LIMIT_SECONDS
-    solver.parameters.num_search_workers = SHIFT_PREVIEW_CP_SAT_SEARCH_WORKERS
+    solver.parameters.num_search_workers = _shift_preview_search_workers(search_workers)
+    solver.parameters.random_seed = SHIFT_PREVIEW_CP_SAT_MIN_OVER_SEED
     status = solver.Solve(model)
     if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
         return None
@@ -1915,6 +2396,7 @@ def _run_shift_preview_cp_sat_fixed_mix_refine_strategy(
     initial_coverage: Optional[List[float]] = None,
     target_rate_counts: Optional[Dict[str, int]] = None,
     max_raw_deficit_fte_hours: Optional[float] = None,
+    search_workers: Optional[int] = None,
 ) -> Optional[Dict[str, Any]]:
     if cp_model is None or not candidates or len(candidates) > SHIFT_PREVIEW_CP_SAT_MIN_OVER_MAX_CANDIDATES:
         return None
@@ -2044,8 +2526,8 @@ def _run_shift_preview_cp_sat_fixed_mix_refine_strategy(
 
     solver = cp_model.CpSolver()
     solver.parameters.max_time_in_seconds = SHIFT_PREVIEW_CP_SAT_FIXED_MIX_REFINE_TIME_LIMIT_SECONDS
-    solver.parameters.num_search_workers = SHIFT_PREVIEW_CP_SAT_SEARCH_WORKERS
-    solver.parameters.random_seed = 23
+    solver.parameters.num_search_workers = _shift_preview_search_workers(search_workers)
+    solver.parameters.random_seed = SHIFT_PREVIEW_CP_SAT_FIXED_MIX_REFINE_SEED
     status = solver.Solve(model)
     if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
         return None
@@ -2105,28 +2587,52 @@ def _select_shift_preview_strategy(
     initial_selected: Optional[List[Dict[str, Any]]] = None,
     allow_cp_sat: bool = True,
 ) -> Dict[str, Any]:
-    cp_sat_result = None
+    cache_key = _shift_preview_result_cache_key(
+        target, candidates, rate_capacity, initial_coverage, initial_selected, allow_cp_sat,
+    )
+    cached = _shift_preview_result_cache_get(cache_key)
+    if cached is not None:
+        return cached
+    result = _run_shift_preview_strategy_portfolio(
+        target,
+        candidates,
+        rate_capacity,
+        initial_coverage=initial_coverage,
+        initial_selected=initial_selected,
+        allow_cp_sat=allow_cp_sat,
+    )
+    _shift_preview_result_cache_put(cache_key, result)
+    return result
+
+
+def _run_shift_preview_strategy_portfolio(
+    target: List[float],
+    candidates: List[Dict[str, Any]],
+    rate_capacity: Dict[str, Dict[str, Any]],
+    initial_coverage: Optional[List[float]] = None,
+    initial_selected: Optional[List[Dict[str, Any]]] = None,
+    allow_cp_sat: bool = True,
+) -> Dict[str, Any]:
+    # Stage 1: CP-SAT (once per seed) and every greedy strategy are independent of each other.
+    stage_calls = []
     if allow_cp_sat and not initial_selected:
-        cp_sat_result = _run_shift_preview_cp_sat_strategy(
-            target,
-            candidates,
-            rate_capacity,
-            initial_coverage=initial_coverage,
+        stage_calls.extend(
+            (
+                "_run_shift_preview_cp_sat_strategy",
+                (target, candidates, rate_capacity),
+                {"initial_coverage": initial_coverage, "random_seed": seed},
+            )
+            for seed in SHIFT_PREVIEW_CP_SAT_PORTFOLIO_SEEDS
         )
-    strategy_results = []
-    if cp_sat_result is not None:
-        strategy_results.append(cp_sat_result)
-    strategy_results.extend([
-        _run_shift_preview_greedy_strategy(
-            target,
-            candidates,
-            rate_capacity,
-            strategy,
-            initial_coverage=initial_coverage,
-            initial_selected=initial_selected,
+    stage_calls.extend(
+        (
+            "_run_shift_preview_greedy_strategy",
+            (target, candidates, rate_capacity, strategy),
+            {"initial_coverage": initial_coverage, "initial_selected": initial_selected},
         )
         for strategy in SHIFT_PREVIEW_GREEDY_STRATEGIES
-    ])
+    )
+    strategy_results = [item for item in _shift_preview_run_strategies(stage_calls) if item is not None]
     proportional_strategy_results = _shift_preview_proportional_results(strategy_results, rate_capacity)
     raw_best_result = _select_best_shift_preview_result(proportional_strategy_results, target)
     best_deficit = min(
@@ -2135,14 +2641,16 @@ def _select_shift_preview_strategy(
     )
     deficit_limit = _shift_preview_default_deficit_limit(target, best_deficit)
     if sum(_shift_preview_rate_mix_counts(rate_capacity).values()) <= 0:
-        min_over_result = _run_shift_preview_cp_sat_min_over_strategy(
-            target,
-            candidates,
-            rate_capacity,
-            max_deficit_fte_hours=deficit_limit,
-            hint_selected=raw_best_result.get("selected") or [],
-            initial_coverage=initial_coverage,
-        )
+        # Through the pool as well: the solve takes a slot and a share of the worker budget.
+        min_over_result = _shift_preview_run_strategies([(
+            "_run_shift_preview_cp_sat_min_over_strategy",
+            (target, candidates, rate_capacity),
+            {
+                "max_deficit_fte_hours": deficit_limit,
+                "hint_selected": raw_best_result.get("selected") or [],
+                "initial_coverage": initial_coverage,
+            },
+        )])[0]
         if min_over_result is not None:
             strategy_results.append(min_over_result)
             proportional_strategy_results = _shift_preview_proportional_results(strategy_results, rate_capacity)
@@ -2191,23 +2699,23 @@ def _select_shift_preview_strategy(
     if min_total > 8:
         candidate_totals.add(min_total - 8)
 
-    fixed_mix_results = []
+    # Stage 2: one fixed-mix refine per candidate total, independent of each other.
+    refine_calls = []
     for total_shifts in sorted(candidate_totals):
         seed_for_total = min(
             proportional_combined_results,
             key=lambda item: abs(len(item.get("selected") or []) - total_shifts),
         )
-        fixed_mix_refined = _run_shift_preview_cp_sat_fixed_mix_refine_strategy(
-            target,
-            candidates,
-            rate_capacity,
-            seed_for_total,
-            initial_coverage=initial_coverage,
-            target_rate_counts=_shift_preview_rate_mix_target_counts(total_shifts, rate_capacity),
-            max_raw_deficit_fte_hours=best_raw_deficit,
-        )
-        if fixed_mix_refined is not None:
-            fixed_mix_results.append(fixed_mix_refined)
+        refine_calls.append((
+            "_run_shift_preview_cp_sat_fixed_mix_refine_strategy",
+            (target, candidates, rate_capacity, seed_for_total),
+            {
+                "initial_coverage": initial_coverage,
+                "target_rate_counts": _shift_preview_rate_mix_target_counts(total_shifts, rate_capacity),
+                "max_raw_deficit_fte_hours": best_raw_deficit,
+            },
+        ))
+    fixed_mix_results = [item for item in _shift_preview_run_strategies(refine_calls) if item is not None]
 
     if fixed_mix_results:
         combined_results.extend(fixed_mix_results)
@@ -2544,18 +3052,22 @@ def _generate_schedule_preview_from_forecast(
     freeform_candidates = _build_shift_preview_candidates(days, freeform_templates, rate_capacity, "freeform", total_hours)
     initial_coverage = _shift_preview_initial_coverage_from_carry_in(carry_in_shifts, total_hours)
     carry_in_display_shifts = _shift_preview_carry_in_display_shifts(carry_in_shifts)
-    template_selected_result = _select_shift_preview_strategy(
-        target,
-        template_candidates,
-        rate_capacity,
-        initial_coverage=initial_coverage,
-    )
-    freeform_selected_result = _select_shift_preview_strategy(
-        target,
-        freeform_candidates,
-        rate_capacity,
-        initial_coverage=initial_coverage,
-    )
+    # Template and freeform selections are independent: dispatch them side by side; their
+    # strategies share the process pool.
+    template_selected_result, freeform_selected_result = _shift_preview_run_parallel([
+        lambda: _select_shift_preview_strategy(
+            target,
+            template_candidates,
+            rate_capacity,
+            initial_coverage=initial_coverage,
+        ),
+        lambda: _select_shift_preview_strategy(
+            target,
+            freeform_candidates,
+            rate_capacity,
+            initial_coverage=initial_coverage,
+        ),
+    ])
     template_variant = _build_schedule_preview_variant(
         "templates",
         "По шаблонам",
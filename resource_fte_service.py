@@ -16,8 +16,11 @@ from resource_fte.calculations import (
     _build_forecast_payload,
     _compute_historical_forecast_profile_for_day_tx,
     _compute_period_forecast_profiles_tx,
+    _compute_forecast_profiles_for_dates_tx,
     _compute_recent_incident_uplift_profile_tx,
     _compute_week_forecast_profiles_tx,
+    _forecast_dates_affected_by_history,
+    _forecast_profile_settings_hash,
     _next_week_start_date,
     _week_start_date,
 )
@@ -1011,11 +1014,42 @@ def _refresh_historical_forecast_for_day_tx(cursor, report_date, settings: Dict[
     return profile
 
 
-def _refresh_all_historical_forecasts_tx(cursor, settings: Dict[str, Any]) -> None:
-    cursor.execute("SELECT report_date FROM daily_resource_summary ORDER BY report_date ASC")
+def _refresh_all_historical_forecasts_tx(
+    cursor,
+    settings: Dict[str, Any],
+    changed_dates: Optional[List[Any]] = None,
+) -> None:
+    """Пересчитывает сохранённый прогноз прошедших дней.
+
+    changed_dates — только что загруженные дни: тогда трогаем лишь их и дни,
+    для которых они служат историей (через 14 и 21 день). Если настройки профиля
+    поменялись с прошлого полного пересчёта, пересчитываем всё, как раньше.
+    """
+    settings_hash = _forecast_profile_settings_hash(settings)
+    cursor.execute("SELECT historical_forecast_settings_hash FROM resource_settings WHERE id = 1")
+    row = cursor.fetchone()
+    applied_hash = row[0] if row else None
+    if changed_dates is None or applied_hash != settings_hash:
+        cursor.execute("SELECT report_date FROM daily_resource_summary ORDER BY report_date ASC")
+    else:
+        cursor.execute(
+            """
+            SELECT report_date
+            FROM daily_resource_summary
+            WHERE report_date = ANY(%s)
+            ORDER BY report_date ASC
+            """,
+            (_forecast_dates_affected_by_history(changed_dates),),
+        )
     report_dates = [row[0] for row in cursor.fetchall()]
-    for report_date in report_dates:
-        _refresh_historical_forecast_for_day_tx(cursor, report_date, settings)
+    profiles = _compute_forecast_profiles_for_dates_tx(cursor, report_dates, settings)
+    for report_date, profile in zip(report_dates, profiles):
+        _apply_profile_forecast_to_day_tx(cursor, report_date, profile)
+    if applied_hash != settings_hash:
+        cursor.execute(
+            "UPDATE resource_settings SET historical_forecast_settings_hash = %s WHERE id = 1",
+            (settings_hash,),
+        )
 
 
 def _resource_schedule_direction_ids_from_settings(settings: Optional[Dict[str, Any]]) -> List[int]:
@@ -1269,7 +1303,7 @@ def import_resource_days(
                 values,
             )
             _refresh_daily_summary_tx(cursor, report_date)
-        _refresh_all_historical_forecasts_tx(cursor, settings)
+        _refresh_all_historical_forecasts_tx(cursor, settings, changed_dates=uploaded_dates)
     primary_report_date = max(uploaded_dates) if uploaded_dates else None
     day_payload = get_resource_day(db, primary_report_date.isoformat()) if primary_report_date else None
     return {
@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+"""Исполнение джоб планировщика: пулы по классам джоб, бюджет на внешнюю систему, учёт.
+
+AsyncIOScheduler крутится в цикле aiogram, а блокирующую работу джобы отдают
+в executor_pool — тот же пул на четыре места, в котором бот и Flask читают
+пользователя и собирают ответы. Ночной синк Oktell, отбивка табло и выгрузка
+amoCRM, совпав по времени, занимали его целиком, и кнопки бота ждали. Модуль
+разводит их, не переписывая сами джобы.
+
+ПУЛЫ. Джоба относится к классу по своему id (classify: первый подходящий
+шаблон fnmatch из classes), у класса — свой именованный пул нитей
+('job-<пул>' — так он виден и в учёте пула PostgreSQL). executor_pool
+становится JobAwareExecutor: run_in_executor изнутри джобы попадает в пул её
+класса, а вне джоб (бот, Flask, ручной запуск синка) — в прежний пул. Поэтому
+тела джоб не меняются, а перенос джобы в другой пул — одна строка в classes.
+
+БЮДЖЕТ СИСТЕМЫ. Классы разных пулов могут ходить в одну внешнюю систему
+(Chat2Desk — синк метрик и отбивка чатов). budgets ограничивает число
+одновременных шагов на систему поверх размеров пулов.
+
+ПРОЦЕСС. Пул, заданный как ('process', N), — отдельные процессы (spawn). Туда
+годится только то, что переживает pickle: функция уровня модуля, который
+импортируется без побочных эффектов. Замыкания и всё, что живёт в
+bot_schedule2 (он на импорте поднимает бота и пул БД), остаются в нитях.
+Семантика misfire_grace_time/coalesce/max_instances не меняется: джобой для
+APScheduler остаётся обёртка instrument(), и она ждёт свою работу, где бы та
+ни шла.
+
+УЧЁТ. По id джобы: прогоны, ошибки, идущие сейчас, длительность
+(последняя/средняя/максимум), очередь к пулу (сколько ждёт и сколько ждали) и
+перебеги — прогон дольше интервала расписания. Перебег значит, что следующий
+запуск пришёлся на ещё идущий и был склеен (coalesce) или пропущен.
+
+ЖУРНАЛ. Каждый прогон, закончившись, уходит записью в journal (в боте — таблица
+scheduler_job_runs): начало и конец, длительность, обработанные строки, внешние
+вызовы, ожидание пула и бюджета, ошибка. Строки джоба отмечает сама
+(count_rows) или их берём из её итога (result_rows: синки отдают словарь со
+счётчиками); внешние вызовы считает http_clients (count_external_call). Синки
+не бросают, а возвращают {'status': 'failed', 'error': ...} — это тоже ошибка
+прогона. Запись идёт в отдельной нити: цикл и пулы джоб базу журнала не ждут.
+
+ТРЕВОГА. По последним RECENT_RUNS прогонам считается p95 длительности. Когда
+он дорастает до NEAR_OVERLAP_RATIO интервала, джоба ещё не перебегает, но вот-вот
+начнёт — в лог уходит предупреждение, один раз на смену состояния. То же
+правило (overlap_alert) размечает тренды журнала в админке.
+
+Модуль не импортирует bot_schedule2 и database: он тестируется без них.
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import fnmatch
+import functools
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+
+import pg_pool_metrics
+
+JobSpec = namedtuple('JobSpec', 'job_id pool system')
+
+_current_job = contextvars.ContextVar('scheduler_job', default=None)
+_current_run = contextvars.ContextVar('scheduler_job_run', default=None)
+
+# Окно прогонов для живого p95 и доля интервала, с которой джоба «подбирается» к перебегу.
+RECENT_RUNS = 20
+NEAR_OVERLAP_RATIO = 0.8
+
+# Ключи итога синков, в которых лежит число обработанных строк (первый найденный).
+RESULT_ROW_KEYS = ('rows', 'oktell_rows', 'source_rows', 'hours_count', 'written',
+                   'inserted', 'upserted', 'processed', 'fetched', 'sent')
+RESULT_FAILED_STATUSES = ('failed', 'partial_failed', 'error')
+
+
+def current_job():
+    """JobSpec джобы, внутри которой выполняется код, или None."""
+    return _current_job.get()
+
+
+class JobRun:
+    """Счётчики одного прогона; шаги в нитях пула прибавляют к ним под замком."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.started_at = datetime.now().astimezone()
+        self.rows = None
+        self.external_calls = 0
+        self.queue_wait = 0.0
+        self.budget_wait = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, rows=0, external_calls=0, queue_wait=0.0, budget_wait=0.0):
+        with self._lock:
+            if rows:
+                self.rows = (self.rows or 0) + int(rows)
+            self.external_calls += external_calls
+            self.queue_wait += queue_wait
+            self.budget_wait += budget_wait
+
+
+def count_rows(rows):
+    """Отметить обработанные строки в текущем прогоне джобы; вне джобы — ничего."""
+    run = _current_run.get()
+    if run is not None and rows:
+        run.add(rows=rows)
+
+
+def count_external_call(calls=1):
+    """Отметить вызов внешней системы в текущем прогоне джобы; вне джобы — ничего."""
+    run = _current_run.get()
+    if run is not None:
+        run.add(external_calls=calls)
+
+
+def result_rows(result):
+    """Число строк из итога джобы: само число или первый счётчик из RESULT_ROW_KEYS."""
+    if isinstance(result, bool):
+        return None
+    if isinstance(result, int):
+        return result
+    if isinstance(result, dict):
+        for key in RESULT_ROW_KEYS:
+            value = result.get(key)
+            if isinstance(value, int) and not isinstance(value, bool):
+                return value
+    return None
+
+
+def result_error(result):
+    """Ошибка, о которой итог синка сообщает словарём вместо исключения, или None."""
+    if isinstance(result, dict) and result.get('status') in RESULT_FAILED_STATUSES:
+        return str(result.get('error') or result.get('status'))[:500]
+    return None
+
+
+def overlap_alert(p95_seconds, interval_seconds, near_ratio=NEAR_OVERLAP_RATIO):
+    """'overrun' — p95 дольше интервала, 'near' — дорос до near_ratio его доли, иначе None."""
+    if p95_seconds is None or not interval_seconds:
+        return None
+    if p95_seconds > interval_seconds:
+        return 'overrun'
+    if p95_seconds >= near_ratio * interval_seconds:
+        return 'near'
+    return None
+
+
+def trend_report(buckets, near_ratio=NEAR_OVERLAP_RATIO):
+    """Тренды журнала по джобам из строк «джоба × период» (как их отдаёт база).
+
+    У каждой джобы — её периоды по порядку, p95 последнего периода против интервала
+    (alert — как overlap_alert) и рост p95 от первого периода к последнему. Сверху —
+    джобы, ближе всех подошедшие к своему интервалу.
+    """
+    jobs = {}
+    for bucket in buckets:
+        jobs.setdefault(bucket['job_id'], []).append(bucket)
+    report = []
+    for job_id, rows in jobs.items():
+        rows.sort(key=lambda row: row['bucket'])
+        first, last = rows[0], rows[-1]
+        interval = next((row['interval_seconds'] for row in reversed(rows)
+                         if row.get('interval_seconds')), None)
+        last_p95 = last['p95_ms'] / 1000.0 if last.get('p95_ms') is not None else None
+        growth = None
+        if len(rows) > 1 and first.get('p95_ms') and last.get('p95_ms') is not None:
+            growth = round(last['p95_ms'] / first['p95_ms'], 2)
+        report.append({
+            'job_id': job_id,
+            'interval_seconds': interval,
+            'runs': sum(row['runs'] for row in rows),
+            'failures': sum(row['failures'] for row in rows),
+            'p95_seconds': round(last_p95, 3) if last_p95 is not None else None,
+            'interval_share': (round(last_p95 / interval, 3)
+                               if last_p95 is not None and interval else None),
+            'p95_growth': growth,
+            'alert': overlap_alert(last_p95, interval, near_ratio),
+            'trend': rows,
+        })
+    report.sort(key=lambda job: (job['interval_share'] is None, -(job['interval_share'] or 0)))
+    return report
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def trigger_interval_seconds(trigger, now=None):
+    """Промежуток между двумя ближайшими срабатываниями расписания; None — разовое."""
+    if trigger is None:
+        return None
+    try:
+        now = now or datetime.now(getattr(trigger, 'timezone', None))
+        first = trigger.get_next_fire_time(None, now)
+        if first is None:
+            return None
+        second = trigger.get_next_fire_time(first, first + timedelta(microseconds=1))
+    except Exception:  # noqa: BLE001 — расписание без часового пояса и т.п.: просто без интервала
+        return None
+    if second is None:
+        return None
+    return (second - first).total_seconds()
+
+
+def _blank_job_stats():
+    return {
+        'pool': None,
+        'system': None,
+        'runs': 0,
+        'failures': 0,
+        'running': 0,
+        'overruns': 0,
+        'last_seconds': None,
+        'total_seconds': 0.0,
+        'max_seconds': 0.0,
+        'interval_seconds': None,
+        'last_started_at': None,
+        'last_error': None,
+        'queued': 0,
+        'queue_wait_total_seconds': 0.0,
+        'queue_wait_max_seconds': 0.0,
+        'budget_wait_total_seconds': 0.0,
+        'steps': 0,
+        'recent_seconds': deque(maxlen=RECENT_RUNS),
+        'alert': None,
+    }
+
+
+class SchedulerPools:
+    """Именованные пулы джоб, бюджеты систем и учёт по id джобы. Потокобезопасен."""
+
+    def __init__(self, pools, classes=(), budgets=None, default_pool='default',
+                 clock=time.monotonic, journal=None):
+        self.pool_sizes = dict(pools)
+        if default_pool not in self.pool_sizes:
+            raise ValueError(f"нет пула по умолчанию {default_pool!r}")
+        self.classes = tuple(classes)
+        for _pattern, pool, _system in self.classes:
+            if pool not in self.pool_sizes:
+                raise ValueError(f"класс джоб ссылается на неизвестный пул {pool!r}")
+        self.default_pool = default_pool
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._executors = {}
+        self._budgets = {name: threading.BoundedSemaphore(int(limit))
+                         for name, limit in (budgets or {}).items() if int(limit) > 0}
+        self._budget_limits = {name: int(limit) for name, limit in (budgets or {}).items()}
+        self._jobs = {}
+        self._pool_queued = {name: 0 for name in self.pool_sizes}
+        # journal(record) — куда писать законченные прогоны; одна нить, чтобы записи шли по порядку.
+        self.journal = journal
+        self._journal_executor = None
+
+    # ── классы и пулы ───────────────────────────────────────────────────────
+    def classify(self, job_id):
+        """(пул, система) для id джобы: первый подходящий шаблон, иначе пул по умолчанию."""
+        for pattern, pool, system in self.classes:
+            if fnmatch.fnmatchcase(str(job_id), pattern):
+                return pool, system
+        return self.default_pool, None
+
+    def spec(self, job_id):
+        return JobSpec(str(job_id), *self.classify(job_id))
+
+    def executor(self, pool):
+        with self._lock:
+            found = self._executors.get(pool)
+            if found is None:
+                size = self.pool_sizes[pool]
+                if isinstance(size, tuple) and size[0] == 'process':
+                    found = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=int(size[1]), mp_context=multiprocessing.get_context('spawn'))
+                else:
+                    found = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=int(size), thread_name_prefix=f'job-{pool}')
+                self._executors[pool] = found
+            return found
+
+    def is_process_pool(self, pool):
+        size = self.pool_sizes.get(pool)
+        return isinstance(size, tuple) and size[0] == 'process'
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executors, self._executors = list(self._executors.values()), {}
+        for executor in executors:
+            executor.shutdown(wait=wait)
+        if self._journal_executor is not None:
+            self._journal_executor.shutdown(wait=wait)
+            self._journal_executor = None
+
+    # ── исполнение ──────────────────────────────────────────────────────────
+    def submit(self, spec, fn, *args, **kwargs):
+        """Шаг джобы spec в её пул: очередь, бюджет системы, метка потребителя БД."""
+        queued_at = self._clock()
+        run = _current_run.get()
+        with self._lock:
+            self._pool_queued[spec.pool] += 1
+            self._job_stats_locked(spec)['queued'] += 1
+        if self.is_process_pool(spec.pool):
+            # В процесс уезжает сама функция: обёртка с замками не пережила бы pickle.
+            future = self.executor(spec.pool).submit(fn, *args, **kwargs)
+            future.add_done_callback(lambda _future: self._dequeued(spec, queued_at, run))
+            return future
+
+        def _step():
+            self._dequeued(spec, queued_at, run)
+            budget = self._budgets.get(spec.system)
+            budget_wait = 0.0
+            if budget is not None:
+                waited_from = self._clock()
+                budget.acquire()
+                budget_wait = self._clock() - waited_from
+            # Нити пула живут дольше шага: прогон ставим на время шага и снимаем за собой.
+            token = _current_run.set(run)
+            try:
+                with self._lock:
+                    self._job_stats_locked(spec)['budget_wait_total_seconds'] += budget_wait
+                if run is not None:
+                    run.add(budget_wait=budget_wait)
+                with pg_pool_metrics.consumer(f"job:{spec.job_id}"):
+                    return fn(*args, **kwargs)
+            finally:
+                _current_run.reset(token)
+                if budget is not None:
+                    budget.release()
+
+        return self.executor(spec.pool).submit(_step)
+
+    def _dequeued(self, spec, queued_at, run=None):
+        waited = self._clock() - queued_at
+        if run is not None:
+            run.add(queue_wait=waited)
+        with self._lock:
+            self._pool_queued[spec.pool] -= 1
+            stats = self._job_stats_locked(spec)
+            stats['queued'] -= 1
+            stats['steps'] += 1
+            stats['queue_wait_total_seconds'] += waited
+            stats['queue_wait_max_seconds'] = max(stats['queue_wait_max_seconds'], waited)
+
+    def instrument(self, job_id, func, trigger=None):
+        """Обёртка для add_job/modify_job: учёт прогона и пул класса для его шагов.
+
+        Корутина выполняется в цикле как прежде, но её run_in_executor(executor_pool)
+        уходит в пул класса. Синхронная функция целиком уезжает в этот пул — раньше
+        AsyncIOScheduler гонял её в пуле цикла по умолчанию.
+        """
+        spec = self.spec(job_id)
+        is_coroutine = asyncio.iscoroutinefunction(func)
+
+        @functools.wraps(func)
+        async def _job(*args, **kwargs):
+            run = JobRun(spec)
+            token = _current_job.set(spec)
+            run_token = _current_run.set(run)
+            started = self._clock()
+            interval = trigger_interval_seconds(trigger)
+            self._begin(spec, interval)
+            error = result = None
+            try:
+                if is_coroutine:
+                    result = await func(*args, **kwargs)
+                else:
+                    result = await asyncio.wrap_future(self.submit(spec, func, *args, **kwargs))
+                return result
+            except BaseException as exc:
+                error = exc
+                raise
+            finally:
+                _current_run.reset(run_token)
+                _current_job.reset(token)
+                elapsed = self._clock() - started
+                self._finish(spec, elapsed, interval, error)
+                self._write_journal(run, elapsed, interval, error, result)
+
+        return _job
+
+    # ── учёт ────────────────────────────────────────────────────────────────
+    def _job_stats_locked(self, spec):
+        stats = self._jobs.get(spec.job_id)
+        if stats is None:
+            stats = _blank_job_stats()
+            self._jobs[spec.job_id] = stats
+        stats['pool'], stats['system'] = spec.pool, spec.system
+        return stats
+
+    def _begin(self, spec, interval):
+        with self._lock:
+            stats = self._job_stats_locked(spec)
+            stats['running'] += 1
+            stats['interval_seconds'] = interval
+            stats['last_started_at'] = datetime.now().isoformat(timespec='seconds')
+
+    def _finish(self, spec, elapsed, interval, error):
+        overrun = interval is not None and elapsed > interval
+        with self._lock:
+            stats = self._job_stats_locked(spec)
+            stats['running'] -= 1
+            stats['runs'] += 1
+            stats['last_seconds'] = elapsed
+            stats['total_seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+            if overrun:
+                stats['overruns'] += 1
+            if error is not None:
+                stats['failures'] += 1
+                stats['last_error'] = f"{type(error).__name__}: {str(error)[:200]}"
+            stats['recent_seconds'].append(elapsed)
+            p95 = _percentile(stats['recent_seconds'], 0.95)
+            alert, previous = overlap_alert(p95, interval), stats['alert']
+            stats['alert'] = alert
+        if overrun:
+            logging.warning(
+                "scheduler: джоба %s шла %.1f с при интервале %.0f с — следующий запуск "
+                "склеен или пропущен", spec.job_id, elapsed, interval)
+        if alert != previous:
+            if alert is not None:
+                logging.warning(
+                    "scheduler: джоба %s подбирается к перекрытию — p95 %.1f с за последние %s "
+                    "прогонов при интервале %.0f с (%s)",
+                    spec.job_id, p95, len(stats['recent_seconds']), interval, alert)
+            elif previous is not None:
+                logging.info("scheduler: джоба %s снова укладывается в интервал", spec.job_id)
+
+    def _write_journal(self, run, elapsed, interval, error, result):
+        if self.journal is None:
+            return
+        if error is not None:
+            error_text = f"{type(error).__name__}: {str(error)[:500]}"
+        else:
+            error_text = result_error(result)
+        finished_at = datetime.now().astimezone()
+        with run._lock:
+            rows = run.rows if run.rows is not None else result_rows(result)
+            record = {
+                'job_id': run.spec.job_id,
+                'pool': run.spec.pool,
+                'started_at': run.started_at,
+                'finished_at': finished_at,
+                'duration_ms': int(round(elapsed * 1000)),
+                'ok': error_text is None,
+                'rows_processed': rows,
+                'external_calls': run.external_calls,
+                'queue_wait_ms': int(round(run.queue_wait * 1000)),
+                'budget_wait_ms': int(round(run.budget_wait * 1000)),
+                'interval_seconds': int(interval) if interval is not None else None,
+                'error': error_text,
+            }
+        with self._lock:
+            if self._journal_executor is None:
+                self._journal_executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='job-journal')
+            executor = self._journal_executor
+        executor.submit(self._journal_write, record)
+
+    def _journal_write(self, record):
+        try:
+            self.journal(record)
+        except Exception:  # noqa: BLE001 — журнал не должен ронять джобы
+            logging.exception("scheduler: не удалось записать прогон %s в журнал", record['job_id'])
+
+    def snapshot(self):
+        """Сводка: пулы (размер, очередь), бюджеты систем, джобы (от самых долгих)."""
+        with self._lock:
+            jobs = {job_id: dict(stats, recent_seconds=list(stats['recent_seconds']))
+                    for job_id, stats in self._jobs.items()}
+            pools = {name: {'size': size if not isinstance(size, tuple) else f'{size[0]}:{size[1]}',
+                            'queued': self._pool_queued[name]}
+                     for name, size in self.pool_sizes.items()}
+        rows = []
+        for job_id, stats in jobs.items():
+            runs = stats['runs']
+            steps = stats['steps']
+            recent = stats.pop('recent_seconds')
+            row = {'job_id': job_id, **stats}
+            row['p50_seconds'] = _percentile(recent, 0.5)
+            row['p95_seconds'] = _percentile(recent, 0.95)
+            row['avg_seconds'] = round(stats['total_seconds'] / runs, 3) if runs else None
+            row['queue_wait_avg_seconds'] = (
+                round(stats['queue_wait_total_seconds'] / steps, 3) if steps else None)
+            for key in ('last_seconds', 'total_seconds', 'max_seconds', 'queue_wait_total_seconds',
+                        'queue_wait_max_seconds', 'budget_wait_total_seconds', 'p50_seconds',
+                        'p95_seconds'):
+                if row[key] is not None:
+                    row[key] = round(row[key], 3)
+            rows.append(row)
+        rows.sort(key=lambda row: row['total_seconds'], reverse=True)
+        return {'pools': pools, 'budgets': dict(self._budget_limits), 'jobs': rows}
+
+    def reset_stats(self):
+        with self._lock:
+            for job_id, stats in list(self._jobs.items()):
+                # Идущие прогоны и очередь — состояние, а не счётчики: их не обнуляем.
+                fresh = _blank_job_stats()
+                for key in ('pool', 'system', 'running', 'queued', 'interval_seconds'):
+                    fresh[key] = stats[key]
+                self._jobs[job_id] = fresh
+
+
+class JobAwareExecutor(concurrent.futures.Executor):
+    """Executor для run_in_executor: шаги джобы — в пул её класса, остальное — в fallback."""
+
+    def __init__(self, pools, fallback):
+        self._pools = pools
+        self._fallback = fallback
+
+    def submit(self, fn, /, *args, **kwargs):
+        spec = _current_job.get()
+        if spec is None:
+            return self._fallback.submit(fn, *args, **kwargs)
+        return self._pools.submit(spec, fn, *args, **kwargs)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self._fallback.shutdown(wait=wait, cancel_futures=cancel_futures)
+        self._pools.shutdown(wait=wait)
@@ -4,6 +4,12 @@ Runs the same pipeline as `build_resource_schedule_preview` but against
 DATABASE_URL_READONLY from .env.codex.local. Used to measure deficit /
 over-coverage / runtime on the actual production-shaped period.
 
+The preview is generated three times: sequentially (one strategy after
+another in-process, a single CP-SAT seed, as before), with the process-pool
+portfolio (the default), and once more from the result cache. The wall-clock
+of all three is reported, and the selected schedule of the portfolio run is
+compared with the sequential one (deficit first, then over-coverage).
+
 Usage:
     python scripts/benchmark_real_data.py [start_date end_date]
 Default period: 2026-05-25 .. 2026-05-31.
@@ -151,6 +157,29 @@ def _fetch_inputs(period_start, period_end):
     return forecast_payload, operator_capacity, carry_in_shifts
 
 
+def _timed_preview(forecast_payload, templates, operator_capacity, carry_in_shifts,
+                   process_workers, cp_sat_seeds, clear_cache=True):
+    """Generate the preview once with the given portfolio; returns (preview, seconds)."""
+    saved = (schedule_generation.SHIFT_PREVIEW_PROCESS_WORKERS,
+             schedule_generation.SHIFT_PREVIEW_CP_SAT_PORTFOLIO_SEEDS)
+    schedule_generation.SHIFT_PREVIEW_PROCESS_WORKERS = process_workers
+    schedule_generation.SHIFT_PREVIEW_CP_SAT_PORTFOLIO_SEEDS = tuple(cp_sat_seeds)
+    if clear_cache:
+        schedule_generation.clear_shift_preview_result_cache()
+    try:
+        t0 = time.perf_counter()
+        preview = _generate_schedule_preview_from_forecast(
+            forecast_payload,
+            templates,
+            operator_capacity,
+            carry_in_shifts=carry_in_shifts,
+        )
+        return preview, time.perf_counter() - t0
+    finally:
+        (schedule_generation.SHIFT_PREVIEW_PROCESS_WORKERS,
+         schedule_generation.SHIFT_PREVIEW_CP_SAT_PORTFOLIO_SEEDS) = saved
+
+
 def _format_rate_mix(rates):
     lines = []
     total_ops = sum(int(r.get("count") or 0) for r in rates) or 1
@@ -183,22 +212,51 @@ def main():
 
     templates = _normalize_shift_templates(None)
 
+    process_workers = schedule_generation.SHIFT_PREVIEW_PROCESS_WORKERS
+    seeds = schedule_generation.SHIFT_PREVIEW_CP_SAT_PORTFOLIO_SEEDS
+    # Profiling wraps module functions, which worker processes do not see: profile the
+    # in-process run.
     profile_stats = _install_profiling()
-    print("generating preview...")
-    t0 = time.perf_counter()
-    preview = _generate_schedule_preview_from_forecast(
-        forecast_payload,
-        templates,
-        operator_capacity,
-        carry_in_shifts=carry_in_shifts,
+    print("generating preview sequentially (before)...")
+    sequential_preview, sequential_elapsed = _timed_preview(
+        forecast_payload, templates, operator_capacity, carry_in_shifts,
+        process_workers=1, cp_sat_seeds=seeds[:1],
+    )
+
+    print("generating preview with the process-pool portfolio (after)...")
+    preview, elapsed = _timed_preview(
+        forecast_payload, templates, operator_capacity, carry_in_shifts,
+        process_workers=process_workers, cp_sat_seeds=seeds,
+    )
+    print("re-opening the same period (result cache)...")
+    _cached_preview, cached_elapsed = _timed_preview(
+        forecast_payload, templates, operator_capacity, carry_in_shifts,
+        process_workers=process_workers, cp_sat_seeds=seeds, clear_cache=False,
     )
-    elapsed = time.perf_counter() - t0
     summary = preview["summary"]
     needed = float(summary.get("neededFteHours") or 0)
     deficit = float(summary.get("deficitFteHours") or 0)
     over = float(summary.get("overFteHours") or 0)
     coverage = float(summary.get("coveragePercent") or 0)
 
+    sequential_summary = sequential_preview["summary"]
+    print("\nwall-clock:")
+    print(f"  sequential:    {sequential_elapsed:.2f}s  "
+          f"(deficit={float(sequential_summary.get('deficitFteHours') or 0):.2f}  "
+          f"over={float(sequential_summary.get('overFteHours') or 0):.2f})")
+    print(f"  portfolio:     {elapsed:.2f}s  "
+          f"(x{sequential_elapsed / elapsed if elapsed else 0:.2f}, "
+          f"processes={schedule_generation._shift_preview_pool_size()}, seeds={list(seeds)}, "
+          f"cp-sat workers per solve={schedule_generation._shift_preview_solve_search_workers()} "
+          f"of {schedule_generation.SHIFT_PREVIEW_CP_SAT_SEARCH_WORKERS})")
+    print(f"  cached:        {cached_elapsed:.2f}s")
+    before = (round(float(sequential_summary.get("deficitFteHours") or 0), 2),
+              round(float(sequential_summary.get("overFteHours") or 0), 2))
+    after = (round(deficit, 2), round(over, 2))
+    verdict = "not worse" if after <= before else "WORSE"
+    print(f"  selected schedule vs sequential: {verdict} "
+          f"(deficit, over) {before} -> {after}")
+
     print(f"\nelapsed:         {elapsed:.2f}s")
     print(f"selectedVariant: {preview.get('selectedVariant')}")
     print(f"needed:          {needed:.2f} FTE-h")
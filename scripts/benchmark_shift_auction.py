@@ -0,0 +1,583 @@
+"""Нагрузочный прогон аукциона смен: «пик разбора» на локальной базе.
+
+Аукцион — самый конкурентный момент системы: сотни операторов в одну секунду
+берут лоты, каждый захват проходит через advisory-lock оператора
+(_lock_shift_auction_operator_tx) и разлетается событием по SSE. Воспроизвести
+такой пик руками нельзя, поэтому скрипт делает это сам — через настоящий HTTP,
+тем же путём, что и браузер:
+
+1. (по --seed) засевает лоты seed_shift_auction_test_lots;
+2. выпускает каждому участнику сессию (user_sessions + access-JWT с JWT_SECRET
+   сервера) — логин по паролю не нужен;
+3. запускает N операторов-корутин: захват / отказ / «свой график» в
+   заданной пропорции, и K слушателей ленты /api/shift_auction/test_events;
+4. раз в секунду снимает /api/admin/db_pool_stats.
+
+Отчёт — p50/p95/p99 по задержке захвата (с клиента), ожиданию lock (из
+Server-Timing «auction-lock», его пишет claim_shift_auction_test_lot), задержке
+доставки события (от ответа на захват до прихода события с тем же лотом в
+SSE) и занятости пула.
+
+Режим --replay проигрывает настоящий журнал захватов
+(/api/shift_auction/test_journal) с исходными паузами (ускорение --speed):
+каждый захват того же оператора на лот той же даты и времени. Доборы после
+аукциона (is_post_auction) не проигрываются — у них другой маршрут.
+
+Только для локальной копии базы: скрипт пишет в user_sessions и, с --seed,
+стирает лоты и выходные аукциона. Сервер поднимается отдельно
+(python bot_schedule2.py), аукцион должен быть открыт; подключение к базе и
+JWT_SECRET — из окружения или .env.codex.local, как у приложения. POSTGRES_HOST
+не на этой машине скрипт отвергает до подключения, если не передан --allow-remote-db.
+
+Запуск:
+    python scripts/benchmark_shift_auction.py --admin-id 1 --operators 200 --duration 60
+    python scripts/benchmark_shift_auction.py --admin-id 1 --seed --listeners 20
+    python scripts/benchmark_shift_auction.py --admin-id 1 --replay --speed 5 --json out.json
+"""
+import argparse
+import asyncio
+import hashlib
+import ipaddress
+import json
+import math
+import os
+import random
+import secrets
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+BENCH_USER_AGENT = 'shift-auction-bench'
+CLAIM_ROUTE = '/api/shift_auction/test_lots/{lot_id}/claim'
+SELF_SCHEDULE_ROUTE = '/api/shift_auction/self_schedule'
+SNAPSHOT_ROUTE = '/api/shift_auction/test_snapshot'
+EVENTS_ROUTE = '/api/shift_auction/test_events'
+JOURNAL_ROUTE = '/api/shift_auction/test_journal'
+POOL_STATS_ROUTE = '/api/admin/db_pool_stats'
+JOURNAL_PAGE_SIZE = 200
+# Стартовые часы «своего графика», которые пробует оператор: сервер сам
+# отклонит лишнее (норма, пересечения), ошибка попадёт в счётчик отказов.
+SELF_SCHEDULE_START_TIMES = ('08:00', '09:00', '10:00', '14:00', '20:00')
+
+
+def _load_env(path):
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8-sig") as handle:
+        for line in handle:
+            stripped = line.strip()
+            if not stripped or stripped.startswith("#") or "=" not in stripped:
+                continue
+            key, value = stripped.split("=", 1)
+            os.environ.setdefault(key.strip(), value.strip().strip('"').strip("'"))
+
+
+# ─────────────── Статистика ───────────────
+
+def percentile(values, pct):
+    """Перцентиль методом ближайшего ранга; None для пустой выборки."""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(values):
+    values = list(values)
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "max": None}
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 2),
+        "p95": round(percentile(values, 95), 2),
+        "p99": round(percentile(values, 99), 2),
+        "max": round(max(values), 2),
+    }
+
+
+def parse_server_timing(header):
+    """'auction-lock;dur=1.2, db;dur=3' → {'auction-lock': 1.2, 'db': 3.0}."""
+    timings = {}
+    for item in str(header or '').split(','):
+        parts = [part.strip() for part in item.split(';')]
+        if not parts or not parts[0]:
+            continue
+        for part in parts[1:]:
+            if part.startswith('dur='):
+                try:
+                    timings[parts[0]] = timings.get(parts[0], 0.0) + float(part[4:])
+                except ValueError:
+                    pass
+    return timings
+
+
+def event_lot_id(event):
+    """id лота из события ленты (в data приходит всё событие целиком)."""
+    payload = event.get('payload') if isinstance(event, dict) else None
+    if not isinstance(payload, dict):
+        return None
+    lot = payload.get('lot') if isinstance(payload.get('lot'), dict) else {}
+    for raw in (lot.get('id'), payload.get('lot_id')):
+        try:
+            if raw not in (None, ''):
+                return int(raw)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def replay_plan(entries, speed=1.0):
+    """Журнал захватов (новые сверху) → [(смещение_с, оператор, дата, начало, конец)].
+
+    Смещения — от первого захвата, делённые на speed; доборы пропускаются.
+    Возвращает (план, число пропущенных записей).
+    """
+    speed = max(float(speed or 1.0), 0.001)
+    rows = []
+    skipped = 0
+    for entry in entries or []:
+        claimed_at = entry.get('claimed_at')
+        if entry.get('is_post_auction') or not claimed_at or entry.get('claimed_by') is None:
+            skipped += 1
+            continue
+        rows.append((
+            datetime.fromisoformat(claimed_at),
+            int(entry['claimed_by']),
+            entry.get('shift_date'),
+            entry.get('start_time'),
+            entry.get('end_time'),
+        ))
+    rows.sort(key=lambda row: row[0])
+    if not rows:
+        return [], skipped
+    first = rows[0][0]
+    plan = [
+        ((claimed_at - first).total_seconds() / speed, operator_id, shift_date, start_time, end_time)
+        for claimed_at, operator_id, shift_date, start_time, end_time in rows
+    ]
+    return plan, skipped
+
+
+class Recorder:
+    """Копилка замеров одного прогона (всё в миллисекундах)."""
+
+    def __init__(self):
+        self.latency = {}
+        self.lock_wait = []
+        self.delivery_lag = []
+        self.pool_in_use = []
+        self.pool_wait_max_ms = {}
+        self.statuses = {}
+        self.claimed_at = {}
+        self.seen_early = {}
+        self.pool_max_conn = None
+
+    def count(self, action, status):
+        key = f"{action}:{status}"
+        self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def request(self, action, elapsed_ms, status, timings=None):
+        self.latency.setdefault(action, []).append(elapsed_ms)
+        self.count(action, status)
+        if timings and 'auction-lock' in timings:
+            self.lock_wait.append(timings['auction-lock'])
+
+    def lot_changed(self, event_type, lot_id, answered_at):
+        key = (event_type, lot_id)
+        self.claimed_at[key] = answered_at
+        # Событие обогнало ответ на захват — для клиента это нулевая задержка.
+        for _ in range(self.seen_early.pop(key, 0)):
+            self.delivery_lag.append(0.0)
+
+    def event_seen(self, event_type, lot_id, seen_at):
+        key = (event_type, lot_id)
+        sent_at = self.claimed_at.get(key)
+        if sent_at is None:
+            self.seen_early[key] = self.seen_early.get(key, 0) + 1
+        else:
+            self.delivery_lag.append(max(0.0, (seen_at - sent_at) * 1000.0))
+
+    def pool_sample(self, stats):
+        pool = stats.get('pool') or {}
+        if pool.get('in_use') is not None:
+            self.pool_in_use.append(float(pool['in_use']))
+        if pool.get('max_conn') is not None:
+            self.pool_max_conn = pool['max_conn']
+        for row in stats.get('consumers') or []:
+            consumer = row.get('consumer')
+            if consumer and str(consumer).startswith('route:api_shift_auction'):
+                wait_ms = float(row.get('wait_max_s') or 0) * 1000.0
+                self.pool_wait_max_ms[consumer] = max(self.pool_wait_max_ms.get(consumer, 0.0), wait_ms)
+
+    def report(self):
+        in_use_peak = max(self.pool_in_use) if self.pool_in_use else None
+        return {
+            "latency_ms": {action: summarize(values) for action, values in sorted(self.latency.items())},
+            "lock_wait_ms": summarize(self.lock_wait),
+            "delivery_lag_ms": summarize(self.delivery_lag),
+            "pool": {
+                "in_use": summarize(self.pool_in_use),
+                "max_conn": self.pool_max_conn,
+                "saturation_peak": (
+                    round(in_use_peak / self.pool_max_conn, 3)
+                    if in_use_peak is not None and self.pool_max_conn else None
+                ),
+                "route_wait_max_ms": {key: round(value, 2) for key, value in sorted(self.pool_wait_max_ms.items())},
+            },
+            "statuses": dict(sorted(self.statuses.items())),
+        }
+
+
+# ─────────────── Сессии и подготовка базы ───────────────
+
+def is_local_db_host(host):
+    """POSTGRES_HOST указывает на эту машину: пусто (сокет libpq по умолчанию),
+    localhost, loopback-адрес или каталог unix-сокета (но не /cloudsql — это прокси
+    к облачной базе)."""
+    host = (host or '').strip()
+    if not host or host.lower() == 'localhost':
+        return True
+    if host.startswith('/'):
+        return not host.startswith('/cloudsql')
+    try:
+        return ipaddress.ip_address(host.strip('[]')).is_loopback
+    except ValueError:
+        return False
+
+
+def _database(allow_remote=False):
+    """Синглтон приложения: импорт database поднимает пул и init_database.
+
+    Импорт уже пишет в базу, поэтому хост проверяется до него."""
+    host = os.getenv('POSTGRES_HOST')
+    if not allow_remote and not is_local_db_host(host):
+        raise SystemExit(
+            f"POSTGRES_HOST={host!r} is not local: the benchmark writes sessions and, with --seed, "
+            "wipes auction lots. Pass --allow-remote-db if this really is a disposable copy")
+    import database as db_module
+    return db_module.db
+
+
+def mint_session(db, user_id, minutes):
+    """Сессия в user_sessions + access-JWT того же вида, что _build_access_token."""
+    import jwt
+
+    secret = (os.getenv('JWT_SECRET') or '').strip()
+    if not secret:
+        raise SystemExit("JWT_SECRET is not set: the server would reject the tokens")
+    user = db.get_user(id=user_id)
+    if not user:
+        raise SystemExit(f"user {user_id} not found")
+    session_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    db.create_user_session(
+        session_id=session_id,
+        user_id=user_id,
+        refresh_token_hash=hashlib.sha256(secrets.token_bytes(32)).hexdigest(),
+        expires_at=datetime.utcnow() + timedelta(minutes=minutes),
+        user_agent=BENCH_USER_AGENT,
+    )
+    token = jwt.encode({
+        "sub": str(user[0]),
+        "role": user[3],
+        "name": user[2],
+        "sid": session_id,
+        "type": "access",
+        "iat": int(now.timestamp()),
+        "exp": int((now + timedelta(minutes=minutes)).timestamp()),
+    }, secret, algorithm="HS256")
+    return session_id, token
+
+
+def _headers(token):
+    return {"Authorization": f"Bearer {token}", "X-Auth-Transport": "bearer"}
+
+
+# ─────────────── Участники прогона ───────────────
+
+async def _timed(session, recorder, action, method, url, **kwargs):
+    started = time.perf_counter()
+    async with session.request(method, url, **kwargs) as response:
+        body = await response.read()
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        recorder.request(action, elapsed_ms, response.status, parse_server_timing(response.headers.get('Server-Timing')))
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            data = {}
+        return response.status, data
+
+
+async def _snapshot(session, base_url, token):
+    async with session.get(base_url + SNAPSHOT_ROUTE, headers=_headers(token)) as response:
+        response.raise_for_status()
+        return await response.json()
+
+
+async def operator_loop(session, base_url, token, recorder, deadline, args, rng):
+    """Один «оператор»: свежий снимок, затем захваты/отказы до дедлайна."""
+    snapshot = await _snapshot(session, base_url, token)
+    lots = {int(lot['id']): lot for lot in snapshot.get('lots') or []}
+    lot_dates = sorted({lot.get('shift_date') for lot in lots.values() if lot.get('shift_date')})
+    self_schedule = bool((snapshot.get('my_time_group') or {}).get('self_schedule_enabled'))
+    mine = set()
+    while time.monotonic() < deadline:
+        roll = rng.random()
+        if self_schedule and lot_dates and roll < args.self_schedule_share:
+            await _timed(
+                session, recorder, 'self_schedule', 'POST', base_url + SELF_SCHEDULE_ROUTE,
+                headers=_headers(token),
+                json={"shift_date": rng.choice(lot_dates), "start_time": rng.choice(SELF_SCHEDULE_START_TIMES)},
+            )
+        elif mine and roll < args.self_schedule_share + args.release_share:
+            lot_id = rng.choice(sorted(mine))
+            status, _ = await _timed(
+                session, recorder, 'release', 'DELETE', base_url + CLAIM_ROUTE.format(lot_id=lot_id),
+                headers=_headers(token),
+            )
+            if status == 200:
+                mine.discard(lot_id)
+                recorder.lot_changed('lot_released', lot_id, time.monotonic())
+        else:
+            candidates = [lot_id for lot_id, lot in lots.items() if lot.get('status') == 'available']
+            if not candidates:
+                # Всё разобрано — перечитать снимок, как сделал бы браузер.
+                snapshot = await _snapshot(session, base_url, token)
+                lots = {int(lot['id']): lot for lot in snapshot.get('lots') or []}
+                if not any(lot.get('status') == 'available' for lot in lots.values()):
+                    break
+                continue
+            lot_id = rng.choice(candidates)
+            status, _ = await _timed(
+                session, recorder, 'claim', 'POST', base_url + CLAIM_ROUTE.format(lot_id=lot_id),
+                headers=_headers(token),
+            )
+            # Взял ли его этот оператор или кто-то раньше — лот больше не свободен.
+            lots[lot_id] = dict(lots[lot_id], status='claimed')
+            if status == 200:
+                mine.add(lot_id)
+                recorder.lot_changed('lot_claimed', lot_id, time.monotonic())
+        if args.think_ms:
+            await asyncio.sleep(rng.uniform(0, args.think_ms) / 1000.0)
+
+
+async def replay_claim(session, base_url, token, recorder, lots_by_slot, shift_date, start_time, end_time):
+    for lot_id in lots_by_slot.get((shift_date, start_time, end_time)) or []:
+        status, _ = await _timed(
+            session, recorder, 'claim', 'POST', base_url + CLAIM_ROUTE.format(lot_id=lot_id),
+            headers=_headers(token),
+        )
+        if status == 200:
+            recorder.lot_changed('lot_claimed', lot_id, time.monotonic())
+            return
+    recorder.count('replay', 'no_lot')
+
+
+async def listener_loop(session, base_url, token, recorder, deadline, after_id):
+    """SSE-слушатель ленты: отмечает приход событий с лотами."""
+    params = {"after": str(after_id)}
+    timeout = max(1.0, deadline - time.monotonic())
+    async with session.get(base_url + EVENTS_ROUTE, headers=_headers(token), params=params,
+                           timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+        recorder.count('sse_connect', response.status)
+        if response.status != 200:
+            return
+        buffer = b''
+        while time.monotonic() < deadline:
+            try:
+                chunk = await asyncio.wait_for(response.content.readany(), timeout=max(0.1, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                break
+            if not chunk:
+                break
+            seen_at = time.monotonic()
+            buffer += chunk
+            while b'\n\n' in buffer:
+                frame, buffer = buffer.split(b'\n\n', 1)
+                for line in frame.decode('utf-8', errors='replace').splitlines():
+                    if not line.startswith('data: '):
+                        continue
+                    try:
+                        event = json.loads(line[6:])
+                    except ValueError:
+                        continue
+                    lot_id = event_lot_id(event)
+                    if lot_id is not None:
+                        recorder.event_seen(event.get('event_type'), lot_id, seen_at)
+
+
+async def pool_sampler(session, base_url, token, recorder, deadline):
+    # POST обнуляет счётчики: в отчёт попадает только окно прогона.
+    async with session.post(base_url + POOL_STATS_ROUTE, headers=_headers(token)) as response:
+        await response.read()
+    while time.monotonic() < deadline:
+        async with session.get(base_url + POOL_STATS_ROUTE, headers=_headers(token)) as response:
+            if response.status == 200:
+                recorder.pool_sample(await response.json())
+        await asyncio.sleep(1.0)
+
+
+async def fetch_journal(session, base_url, token):
+    entries = []
+    page = 1
+    while True:
+        async with session.get(base_url + JOURNAL_ROUTE, headers=_headers(token),
+                               params={"page": page, "per_page": JOURNAL_PAGE_SIZE}) as response:
+            response.raise_for_status()
+            data = await response.json()
+        entries.extend(data.get('entries') or [])
+        if not data.get('has_more'):
+            return entries
+        page += 1
+
+
+# ─────────────── Прогон ───────────────
+
+async def run(args):
+    db = _database(allow_remote=args.allow_remote_db)
+    if args.seed:
+        start_date = datetime.strptime(args.seed_start, "%Y-%m-%d").date() if args.seed_start else None
+        seeded = db.seed_shift_auction_test_lots(updated_by=args.admin_id, start_date=start_date)
+        print(f"seeded {seeded['count']} lots")
+
+    sessions = []
+    admin_session, admin_token = mint_session(db, args.admin_id, args.session_minutes)
+    sessions.append(admin_session)
+    recorder = Recorder()
+    connector = aiohttp.TCPConnector(limit=0)
+    try:
+        async with aiohttp.ClientSession(connector=connector) as http:
+            admin_snapshot = await _snapshot(http, args.base_url, admin_token)
+            if admin_snapshot.get('status') != 'open':
+                raise SystemExit(f"auction is {admin_snapshot.get('status')!r}, open it before the run")
+            after_id = int(admin_snapshot.get('last_event_id') or 0)
+
+            if args.replay:
+                plan, skipped = replay_plan(await fetch_journal(http, args.base_url, admin_token), args.speed)
+                operator_ids = sorted({row[1] for row in plan})
+                print(f"replaying {len(plan)} claims of {len(operator_ids)} operators ({skipped} skipped)")
+            else:
+                plan = None
+                operator_ids = list(admin_snapshot.get('selected_operator_ids') or [])[:args.operators]
+                print(f"driving {len(operator_ids)} operators for {args.duration}s")
+            if not operator_ids:
+                raise SystemExit("no auction participants to drive")
+
+            tokens = {}
+            for operator_id in operator_ids:
+                session_id, tokens[operator_id] = mint_session(db, operator_id, args.session_minutes)
+                sessions.append(session_id)
+
+            duration = (plan[-1][0] + 5.0) if plan else float(args.duration)
+            deadline = time.monotonic() + duration
+            tasks = [asyncio.create_task(pool_sampler(http, args.base_url, admin_token, recorder, deadline))]
+            for index in range(args.listeners):
+                token = tokens[operator_ids[index % len(operator_ids)]]
+                tasks.append(asyncio.create_task(
+                    listener_loop(http, args.base_url, token, recorder, deadline, after_id)
+                ))
+            # Дать слушателям подключиться, иначе ранние события уйдут мимо.
+            await asyncio.sleep(0.5)
+
+            if plan:
+                lots_by_slot = {}
+                for lot in admin_snapshot.get('lots') or []:
+                    slot = (lot.get('shift_date'), lot.get('start_time'), lot.get('end_time'))
+                    lots_by_slot.setdefault(slot, []).append(int(lot['id']))
+                started = time.monotonic()
+                workers = []
+                for offset, operator_id, shift_date, start_time, end_time in plan:
+                    delay = started + offset - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    workers.append(asyncio.create_task(replay_claim(
+                        http, args.base_url, tokens[operator_id], recorder,
+                        lots_by_slot, shift_date, start_time, end_time,
+                    )))
+            else:
+                rng = random.Random(args.seed_random)
+                workers = [
+                    asyncio.create_task(operator_loop(
+                        http, args.base_url, tokens[operator_id], recorder, deadline, args,
+                        random.Random(rng.random()),
+                    ))
+                    for operator_id in operator_ids
+                ]
+            await asyncio.gather(*workers, return_exceptions=True)
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        for session_id in sessions:
+            try:
+                db.revoke_user_session(session_id)
+            except Exception as error:
+                print(f"failed to revoke bench session {session_id}: {error}")
+    return recorder.report()
+
+
+def _print_report(report):
+    def line(label, stats):
+        if not stats or not stats.get('count'):
+            print(f"  {label:<22} —")
+            return
+        print(f"  {label:<22} n={stats['count']:<6} p50={stats['p50']:<9} p95={stats['p95']:<9} "
+              f"p99={stats['p99']:<9} max={stats['max']}")
+
+    print("\nlatency, ms:")
+    for action, stats in report["latency_ms"].items():
+        line(action, stats)
+    print("lock wait (auction-lock), ms:")
+    line("lock", report["lock_wait_ms"])
+    print("event delivery lag, ms:")
+    line("sse", report["delivery_lag_ms"])
+    pool = report["pool"]
+    print(f"pool: max_conn={pool['max_conn']} saturation_peak={pool['saturation_peak']}")
+    line("in_use", pool["in_use"])
+    for consumer, wait_ms in pool["route_wait_max_ms"].items():
+        print(f"  wait_max {consumer:<40} {wait_ms} ms")
+    print("statuses:")
+    for key, count in report["statuses"].items():
+        print(f"  {key:<28} {count}")
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Shift auction rush benchmark (local database only)")
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--admin-id', type=int, required=True, help="admin user: seeding, journal, pool stats")
+    parser.add_argument('--operators', type=int, default=100, help="max participants to drive")
+    parser.add_argument('--listeners', type=int, default=10, help="SSE connections watching the feed")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds (synthetic mode)")
+    parser.add_argument('--release-share', type=float, default=0.1)
+    parser.add_argument('--self-schedule-share', type=float, default=0.05)
+    parser.add_argument('--think-ms', type=float, default=50.0, help="max pause between an operator's actions")
+    parser.add_argument('--seed', action='store_true', help="reseed lots via seed_shift_auction_test_lots first")
+    parser.add_argument('--seed-start', default=None, help="first lot date, YYYY-MM-DD")
+    parser.add_argument('--seed-random', type=int, default=1, help="RNG seed of the synthetic mix")
+    parser.add_argument('--replay', action='store_true', help="replay the claim journal instead of a synthetic mix")
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed-up factor")
+    parser.add_argument('--session-minutes', type=int, default=60)
+    parser.add_argument('--json', default=None, help="also write the report to this file")
+    parser.add_argument('--allow-remote-db', action='store_true',
+                        help="run against a POSTGRES_HOST that is not this machine")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    _load_env(os.path.join(ROOT, ".env.codex.local"))
+    report = asyncio.run(run(args))
+    _print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""Движок захватов аукциона смен: групповая запись и мгновенный отказ по занятому лоту.
+
+Раньше каждый захват/отказ был отдельной транзакцией из своей нити waitress:
+своя выдача пула, advisory-lock оператора, своя фиксация. В пик разбора сотни
+операторов жмут на одни и те же лоты, и большинство запросов заканчивается
+LOT_ALREADY_CLAIMED — но узнавали они это, только отстояв очередь к пулу.
+
+ИСТОЧНИК ИСТИНЫ — по-прежнему PostgreSQL. Все проверки (окно, участие, ставка,
+норма, выходные) и CAS-апдейт остаются в claim/release_shift_auction_test_lot;
+движок меняет только то, КАК туда попадают запросы:
+
+ОЧЕРЕДЬ И ГРУППОВАЯ ФИКСАЦИЯ. Запросы ставятся в общую очередь; несколько
+нитей-писателей (writers) забирают из неё всё, что накопилось, и проводят одной
+транзакцией — каждый запрос в своём savepoint, так что отказ одного не
+откатывает соседей. Ожидания «добрать пачку» нет: пока писатель занят,
+очередь наполняется сама. Внутри пачки запросы упорядочены по оператору —
+advisory-lock'и берутся в одном порядке, и пачки разных писателей не
+сцепляются. Пачка, упавшая целиком (обрыв соединения, ошибка фиксации), и
+запрос, упавший не по ValueError (deadlock), проводятся повторно поодиночке.
+
+ПАМЯТЬ ЛОТОВ. Статусы лотов активного периода держатся в памяти процесса и
+догоняются из буфера событий аукциона (тот же, что раздаёт SSE). Захват лота,
+который уже занят, отклоняется сразу, без очереди и без базы. Ошибка в эту
+сторону невозможна надолго: «свободный» в памяти лишь отправляет запрос в базу,
+а «занятый» сверяется с базой полной перечиткой не реже state_max_age_seconds.
+Структурное событие (пересев, перезапуск, смена настроек) и отставание
+дальше окна буфера тоже сбрасывают память — следующая проверка перечитает её
+(«восстановление после сбоя» — та же перечитка: лоты + хвост журнала событий).
+
+Модуль не импортирует ни database, ни bot_schedule2: всё нужное передаётся
+функциями в конструктор.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+# На сколько событий назад от версии перечитки не доверять прочитанным статусам:
+# транзакция с меньшим id события может зафиксироваться позже перечитки, и её
+# лот честнее считать неизвестным (путь через базу), чем «занятым».
+RELOAD_OVERLAP_EVENTS = 50
+# Пауза перед новой попыткой, если перечитка не удалась или буфер событий ещё
+# не готов: без неё каждая проверка ходила бы в базу.
+RELOAD_RETRY_SECONDS = 1.0
+
+
+class ShiftAuctionEngineBusy(RuntimeError):
+    """Запрос не дождался писателя за отведённое время и снят с очереди."""
+
+
+class _Job:
+    __slots__ = ('action', 'operator_id', 'lot_id', 'queued_at', 'state', 'outcome', 'timings', 'done', 'lock')
+
+    def __init__(self, action, operator_id, lot_id):
+        self.action = action
+        self.operator_id = operator_id
+        self.lot_id = lot_id
+        self.queued_at = time.perf_counter()
+        self.state = 'queued'
+        self.outcome = None
+        self.timings = {}
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.state != 'queued':
+                return False
+            self.state = 'running'
+        self.timings['queue'] = (time.perf_counter() - self.queued_at) * 1000
+        return True
+
+    def cancel(self):
+        with self.lock:
+            if self.state != 'queued':
+                return False
+            self.state = 'cancelled'
+            return True
+
+    def finish(self, outcome):
+        self.outcome = outcome
+        self.state = 'done'
+        self.done.set()
+
+
+class ShiftAuctionClaimEngine:
+    """Очередь захватов/отказов с групповой фиксацией и памятью статусов лотов.
+
+    process_batch([(action, operator_id, lot_id), ...]) — провести пачку одной
+    транзакцией, вернуть по исходу на запрос (dict результата или исключение);
+    process_one(action, operator_id, lot_id) — тот же запрос отдельной
+    транзакцией; load_lot_states() — (версия, {lot_id: status}) одним снимком;
+    read_events(after_id) — события после after_id из буфера процесса или None,
+    если буфер не готов или уже не покрывает этот диапазон.
+    """
+
+    def __init__(self, process_batch, process_one, load_lot_states, read_events, lot_event_types,
+                 writers=4, max_batch=16, state_max_age_seconds=30.0, timeout_seconds=15.0):
+        self._process_batch = process_batch
+        self._process_one = process_one
+        self._load_lot_states = load_lot_states
+        self._read_events = read_events
+        self._lot_event_types = frozenset(lot_event_types)
+        self.writers = max(1, int(writers))
+        self.max_batch = max(1, int(max_batch))
+        self.state_max_age_seconds = float(state_max_age_seconds)
+        self.timeout_seconds = float(timeout_seconds)
+
+        self._queue = queue.Queue()
+        self._writers_started = False
+        self._writers_lock = threading.Lock()
+
+        self._state_lock = threading.Lock()
+        self._lots = {}  # lot_id -> (status, id события, после которого он известен)
+        self._version = None
+        self._loaded_at = 0.0
+        self._retry_at = 0.0
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'submitted': 0, 'fast_rejects': 0, 'batches': 0, 'batched_jobs': 0, 'max_batch_seen': 0,
+            'batch_failures': 0, 'single_retries': 0, 'cancelled': 0, 'reloads': 0,
+        }
+
+    # ─────────── Запросы ───────────
+
+    def submit(self, action, operator_id, lot_id):
+        """Провести захват ('claim') или отказ ('release'); ValueError — отказ по правилам аукциона."""
+        operator_id = int(operator_id)
+        lot_id = int(lot_id)
+        self._bump('submitted')
+        if action == 'claim' and self.is_known_claimed(lot_id):
+            self._bump('fast_rejects')
+            raise ValueError("LOT_ALREADY_CLAIMED")
+        self._ensure_writers()
+        job = _Job(action, operator_id, lot_id)
+        self._queue.put(job)
+        if not job.done.wait(self.timeout_seconds):
+            if job.cancel():
+                self._bump('cancelled')
+                raise ShiftAuctionEngineBusy("shift auction writer queue timeout")
+            # Писатель уже взял запрос — его исход важнее таймаута.
+            job.done.wait()
+        if isinstance(job.outcome, BaseException):
+            raise job.outcome
+        result = job.outcome
+        if isinstance(result, dict):
+            timings = result.get('_timings') if isinstance(result.get('_timings'), dict) else {}
+            result['_timings'] = {**timings, **job.timings}
+        return result
+
+    def is_known_claimed(self, lot_id):
+        with self._state_lock:
+            if not self._sync_locked():
+                return False
+            entry = self._lots.get(int(lot_id))
+            return entry is not None and entry[0] == 'claimed'
+
+    def invalidate(self):
+        """Забыть статусы: следующая проверка перечитает их из базы."""
+        with self._state_lock:
+            self._version = None
+            self._retry_at = 0.0
+
+    def snapshot(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        with self._state_lock:
+            stats.update({
+                'known_lots': len(self._lots) if self._version is not None else 0,
+                'version': self._version,
+            })
+        stats.update({'queued': self._queue.qsize(), 'writers': self.writers, 'max_batch': self.max_batch})
+        return stats
+
+    # ─────────── Писатели ───────────
+
+    def _ensure_writers(self):
+        if self._writers_started:
+            return
+        with self._writers_lock:
+            if self._writers_started:
+                return
+            for index in range(self.writers):
+                threading.Thread(
+                    target=self._writer_loop,
+                    name=f'shift-auction-writer-{index}',
+                    daemon=True,
+                ).start()
+            self._writers_started = True
+
+    def _writer_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            jobs = [job for job in batch if job.start()]
+            if jobs:
+                try:
+                    self._run_batch(jobs)
+                except Exception as error:
+                    logging.exception("Shift auction writer failed on a batch")
+                    for job in jobs:
+                        if not job.done.is_set():
+                            job.finish(error)
+
+    def _run_batch(self, jobs):
+        # Порядок по оператору (устойчивый: его собственные запросы — как пришли).
+        jobs = sorted(jobs, key=lambda job: job.operator_id)
+        started_at = time.perf_counter()
+        try:
+            outcomes = self._process_batch([(job.action, job.operator_id, job.lot_id) for job in jobs])
+        except Exception as error:
+            logging.warning("Shift auction batch of %s failed, retrying one by one: %s", len(jobs), error)
+            self._bump('batch_failures')
+            outcomes = [None] * len(jobs)
+        batch_ms = (time.perf_counter() - started_at) * 1000
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['batched_jobs'] += len(jobs)
+            self._stats['max_batch_seen'] = max(self._stats['max_batch_seen'], len(jobs))
+        for job, outcome in zip(jobs, outcomes):
+            job.timings['batch'] = batch_ms
+            if outcome is None or (isinstance(outcome, Exception) and not isinstance(outcome, ValueError)):
+                self._bump('single_retries')
+                try:
+                    outcome = self._process_one(job.action, job.operator_id, job.lot_id)
+                except Exception as error:
+                    outcome = error
+            self._observe(job, outcome)
+            job.finish(outcome)
+
+    def _observe(self, job, outcome):
+        """Учесть в памяти исход, не дожидаясь его события в буфере."""
+        with self._state_lock:
+            if self._version is None:
+                return
+            if isinstance(outcome, dict):
+                self._apply_locked(outcome.get('event') or {}, outcome.get('lot'), removed=bool(outcome.get('removed')))
+            elif isinstance(outcome, ValueError) and str(outcome) == "LOT_ALREADY_CLAIMED":
+                self._set_lot_locked(job.lot_id, 'claimed', self._version)
+
+    # ─────────── Память лотов ───────────
+
+    def _sync_locked(self):
+        now = time.monotonic()
+        for _ in range(2):
+            if self._version is None or now - self._loaded_at > self.state_max_age_seconds:
+                if not self._reload_locked(now):
+                    return False
+                continue
+            events = self._read_events(self._version)
+            if events is None:
+                self._version = None
+                self._retry_at = now + RELOAD_RETRY_SECONDS
+                return False
+            for event in events:
+                if not self._apply_event_locked(event):
+                    # Структурное событие: память устарела целиком.
+                    self._version = None
+                    break
+            else:
+                return True
+        return self._version is not None
+
+    def _reload_locked(self, now):
+        if now < self._retry_at:
+            return False
+        self._version = None
+        try:
+            version, lots = self._load_lot_states()
+            version = int(version or 0)
+            recent = self._read_events(max(0, version - RELOAD_OVERLAP_EVENTS))
+        except Exception as error:
+            logging.warning("Shift auction lot state reload failed: %s", error)
+            self._retry_at = now + RELOAD_RETRY_SECONDS
+            return False
+        if recent is None:
+            self._retry_at = now + RELOAD_RETRY_SECONDS
+            return False
+        self._lots = {int(lot_id): (status, 0) for lot_id, status in (lots or {}).items()}
+        self._version = version
+        self._loaded_at = now
+        self._bump('reloads')
+        for event in recent:
+            if int(event.get('id') or 0) <= version:
+                for lot_id in self._event_lot_ids(event):
+                    self._lots.pop(lot_id, None)
+            elif not self._apply_event_locked(event):
+                self._version = None
+                self._retry_at = now + RELOAD_RETRY_SECONDS
+                return False
+        return True
+
+    def _apply_event_locked(self, event):
+        """False — событие не лотовое (структурное), память надо перечитать."""
+        event_id = int(event.get('id') or 0)
+        event_type = event.get('event_type')
+        if event_type not in self._lot_event_types:
+            return False
+        payload = event.get('payload') if isinstance(event.get('payload'), dict) else {}
+        self._apply_locked(
+            event, payload.get('lot'),
+            removed=event_type == 'self_scheduled_shift_removed', lot_id=payload.get('lot_id'),
+        )
+        self._version = max(self._version or 0, event_id)
+        return True
+
+    def _apply_locked(self, event, lot, removed=False, lot_id=None):
+        event_id = int((event or {}).get('id') or 0)
+        if isinstance(lot, dict) and lot.get('id') is not None:
+            lot_key = int(lot['id'])
+            if removed:
+                self._lots.pop(lot_key, None)
+            elif lot.get('status'):
+                self._set_lot_locked(lot_key, lot['status'], event_id)
+            else:
+                self._lots.pop(lot_key, None)
+        elif lot_id not in (None, ''):
+            self._lots.pop(int(lot_id), None)
+
+    def _set_lot_locked(self, lot_id, status, event_id):
+        current = self._lots.get(lot_id)
+        if current is not None and current[1] > event_id:
+            return
+        self._lots[lot_id] = (status, event_id)
+
+    @staticmethod
+    def _event_lot_ids(event):
+        payload = event.get('payload') if isinstance(event.get('payload'), dict) else {}
+        lot = payload.get('lot') if isinstance(payload.get('lot'), dict) else {}
+        ids = set()
+        for raw in (lot.get('id'), payload.get('lot_id')):
+            try:
+                if raw not in (None, ''):
+                    ids.add(int(raw))
+            except (TypeError, ValueError):
+                continue
+        return ids
+
+    def _bump(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
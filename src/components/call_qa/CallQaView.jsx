@@ -123,11 +123,15 @@ export default function CallQaView(props) {
     };
 
     const QUEUE_PAGE = 30;
-    const loadQueue = (offset = 0, append = false) => {
+    // «Показать ещё» продолжает с курсора последней карточки (keyset), а не со смещения:
+    // пока листают, ревьюеры закрывают карточки, и offset сдвигался бы на них.
+    const loadQueue = (after = null, append = false) => {
         if (append) setQueueMoreBusy(true); else { setQueue(null); setQueueErr(false); }
         if (!apiBaseUrl) { setQueueErr(true); setQueue([]); setQueueMoreBusy(false); return; }
+        const params = { limit: QUEUE_PAGE };
+        if (append && typeof after === 'string') params.after = after;
         axios.get(`${apiBaseUrl}/api/ai-qa/review-queue`,
-            { params: { limit: QUEUE_PAGE, offset }, headers: headers() })
+            { params, headers: headers() })
             .then((r) => {
                 const page = r.data.items || [];
                 setQueueTotal(typeof r.data.total === 'number' ? r.data.total : page.length);
@@ -363,7 +367,7 @@ export default function CallQaView(props) {
                             )}
                             <div className="flex flex-col items-center gap-2 pt-1">
                                 {queue.length < queueTotal && (
-                                    <button type="button" onClick={() => loadQueue(queue.length, true)}
+                                    <button type="button" onClick={() => loadQueue(queue[queue.length - 1]?.cursor, true)}
                                         disabled={queueMoreBusy} className={iosBtnSecondary}>
                                         {queueMoreBusy ? 'Загрузка…' : `Показать ещё (осталось ${queueTotal - queue.length})`}
                                     </button>
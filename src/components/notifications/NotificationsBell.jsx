@@ -4,6 +4,7 @@ import axios from 'axios';
 import { Bell, BookLock, Cake, GraduationCap, Headset, Image, ClipboardList, CalendarDays, ChevronRight, ListChecks, Loader2, X } from 'lucide-react';
 import { APPLE_FONT, IosToggle } from '../ui/ios';
 import { createCoalescedReload } from './coalescedReload.js';
+import { applyBellDelta, parseSseFrame } from './bellDelta.js';
 import {
     buildDesktopNotice,
     desktopPermission as browserPermission,
@@ -168,6 +169,14 @@ export default function NotificationsBell({ apiBaseUrl, user, getHeaders, onNavi
     const pageSizeRef = useRef(PAGE_SIZE);
     const hasMoreRef = useRef(false);
     const loadingMoreRef = useRef(false);
+    /* Последняя сводка, как её знает сервер, — основа для дельт из канала.
+       Ref, а не items: две дельты подряд приходят раньше, чем React успеет
+       перерисовать, и вторая легла бы поверх устаревшего состояния. */
+    const itemsRef = useRef([]);
+    /* Сколько перечиток сводки сейчас в полёте. Дельта, пришедшая во время
+       перечитки, может оказаться новее её ответа — такую не накладываем, а
+       просим ещё одну перечитку. */
+    const snapshotInFlightRef = useRef(0);
 
     useEffect(() => {
         // React StrictMode в dev повторно запускает effects после их cleanup.
@@ -181,9 +190,27 @@ export default function NotificationsBell({ apiBaseUrl, user, getHeaders, onNavi
         };
     }, []);
 
+    /* Принять сводку — полную из /api/notifications или собранную из дельты
+       канала: дальше они неотличимы. */
+    const applySnapshot = useCallback((nextItems, nextCounts, more, nextChangeIn) => {
+        announceRef.current?.(nextItems, nextCounts, more);
+        itemsRef.current = nextItems;
+        setCounts(nextCounts);
+        setItems(nextItems);
+        hasMoreRef.current = more;
+        setHasMore(more);
+        scheduleNextChangeRef.current?.(nextChangeIn);
+        fetchedAtRef.current = Date.now();
+        // Бейджи разделов в сайдбаре берут числа отсюда же: раньше «Ивенты»
+        // и «4 You» ходили за ними своими запросами, считая ровно то же.
+        onCounts?.(nextCounts);
+        onDigest?.(sourceDigest(nextItems));
+    }, [onCounts, onDigest]);
+
     const reloadSnapshot = useCallback(async () => {
         const requestedUserId = user?.id;
         if (!aliveRef.current || !requestedUserId) return;
+        snapshotInFlightRef.current += 1;
         try {
             const response = await axios.get(`${apiBaseUrl}/api/notifications`, {
                 headers: getHeaders(),
@@ -192,27 +219,40 @@ export default function NotificationsBell({ apiBaseUrl, user, getHeaders, onNavi
             // При logout/login без размонтирования старый ответ не должен на
             // мгновение показать новому пользователю чужие уведомления.
             if (!aliveRef.current || userIdRef.current !== requestedUserId) return;
-            const nextCounts = response?.data?.counts || { total: 0 };
-            const nextItems = Array.isArray(response?.data?.items) ? response.data.items : [];
-            announceRef.current?.(nextItems, nextCounts, Boolean(response?.data?.has_more));
-            setCounts(nextCounts);
-            setItems(nextItems);
-            const more = Boolean(response?.data?.has_more);
-            hasMoreRef.current = more;
-            setHasMore(more);
-            scheduleNextChangeRef.current?.(response?.data?.next_change_in);
-            fetchedAtRef.current = Date.now();
-            // Бейджи разделов в сайдбаре берут числа отсюда же: раньше «Ивенты»
-            // и «4 You» ходили за ними своими запросами, считая ровно то же.
-            onCounts?.(nextCounts);
-            onDigest?.(sourceDigest(nextItems));
+            applySnapshot(
+                Array.isArray(response?.data?.items) ? response.data.items : [],
+                response?.data?.counts || { total: 0 },
+                Boolean(response?.data?.has_more),
+                response?.data?.next_change_in,
+            );
         } catch (e) {
             /* Сетевой сбой или 503 «сводку собрать не удалось». Ничего не
                трогаем: прежние числа честнее, чем нули, которых сервер не
                присылал. onCounts намеренно НЕ вызывается — иначе бейджи
                сайдбара погасли бы из-за недоступности базы. */
+        } finally {
+            snapshotInFlightRef.current -= 1;
         }
-    }, [apiBaseUrl, getHeaders, onCounts, onDigest, user?.id]);
+    }, [apiBaseUrl, getHeaders, applySnapshot, user?.id]);
+
+    /* Дельта из канала. Собрана под другой размер порции (список успели
+       докрутить) или пришла посреди перечитки — значит, наложить её честно
+       нельзя, и она превращается в обычную перечитку. */
+    const applyDelta = useCallback((delta, fallback) => {
+        if (!delta || Number(delta.limit) !== pageSizeRef.current
+            || snapshotInFlightRef.current > 0 || knownKeysRef.current === null) {
+            fallback();
+            return;
+        }
+        applySnapshot(
+            applyBellDelta(itemsRef.current, delta),
+            delta.counts || { total: 0 },
+            Boolean(delta.has_more),
+            delta.next_change_in,
+        );
+    }, [applySnapshot]);
+    const applyDeltaRef = useRef(applyDelta);
+    applyDeltaRef.current = applyDelta;
 
     // Сам gate живёт весь срок компонента, а ref подставляет ему актуальные
     // URL, токен и пользователя без сброса single-flight на каждом рендере.
@@ -304,6 +344,7 @@ export default function NotificationsBell({ apiBaseUrl, user, getHeaders, onNavi
         knownKeysRef.current = null;
         totalRef.current = 0;
         if (!user?.id) {
+            itemsRef.current = [];
             setCounts({ total: 0 });
             setItems([]);
             // Вышли из портала — гасим и отложенное пробуждение: перечитывать
@@ -335,7 +376,11 @@ export default function NotificationsBell({ apiBaseUrl, user, getHeaders, onNavi
        соединение и отдаёт слот (их на сервере ровно BELL_STREAM_LIMIT — каждый
        поток занимает нить waitress). Любой отказ канала — молчаливый откат на
        прежнее обновление по фокусу, колокол без реалтайма остаётся полностью
-       рабочим. */
+       рабочим.
+       Канал просится в режим дельт (?mode=delta): вместо тычка сервер шлёт
+       пересчитанные источники (event: delta), и перечитывать сводку не нужно.
+       Сервер без этого режима отвечает прежними тычками reload — их ветка ниже
+       осталась как была. */
     useEffect(() => {
         if (!user?.id) return undefined;
         let cancelled = false;
@@ -347,6 +392,10 @@ export default function NotificationsBell({ apiBaseUrl, user, getHeaders, onNavi
         // Канал сейчас читается. Нужен, чтобы возврат во вкладку не рвал поток,
         // переживший сворачивание, и не занимал слот заново.
         let live = false;
+        /* Номер последнего кадра режима дельт (id: в потоке). С ним
+           переподключение продолжает с того же места: сервер дошлёт дельту за
+           пропущенное или, если курсор уже выпал из его кольца, reload. */
+        let lastSeq = null;
 
         /* Обычно скрытая вкладка отпускает слот: их всего BELL_STREAM_LIMIT на
            ~96 нитей waitress, и держать канал ради никем не видимой страницы
@@ -397,7 +446,10 @@ export default function NotificationsBell({ apiBaseUrl, user, getHeaders, onNavi
             // что proxy/соединение зависло и его нужно создать заново.
             armWatchdog();
             try {
-                const response = await fetch(`${apiBaseUrl}/api/notifications/stream`, {
+                const params = new URLSearchParams({ mode: 'delta', limit: String(pageSizeRef.current) });
+                if (lastSeq !== null) params.set('after', String(lastSeq));
+                const resumed = lastSeq !== null;
+                const response = await fetch(`${apiBaseUrl}/api/notifications/stream?${params}`, {
                     headers: { ...getHeaders(), Accept: 'text/event-stream' },
                     signal: controller.signal,
                     credentials: 'include',
@@ -428,19 +480,31 @@ export default function NotificationsBell({ apiBaseUrl, user, getHeaders, onNavi
                     buffer += decoder.decode(value, { stream: true });
                     const chunks = buffer.split('\n\n');
                     buffer = chunks.pop() || '';
-                    if (!connected && chunks.some((chunk) => chunk
-                        .split('\n')
-                        .some((line) => line.startsWith(': connected')))) {
+                    const frames = chunks.map(parseSseFrame);
+                    if (!connected && frames.some((frame) => frame.comment?.startsWith('connected'))) {
                         connected = true;
                         attempt = 0;
                         /* Сервер фиксирует current_seq перед этим фреймом. Snapshot
                            после него закрывает окно между первой загрузкой и
-                           подпиской; reload во время snapshot попадёт в очередь. */
-                        load();
+                           подпиской; reload во время snapshot попадёт в очередь.
+                           Продолжение по курсору snapshot не нужно: пропущенное
+                           сервер дошлёт сам — дельтой или reload. */
+                        if (!resumed) load();
                     }
-                    const poked = chunks.some((chunk) => chunk
-                        .split('\n')
-                        .some((line) => line.startsWith('event: reload')));
+                    let poked = false;
+                    frames.forEach((frame) => {
+                        if (frame.id !== null && /^\d+$/.test(frame.id)) lastSeq = Number(frame.id);
+                        if (frame.event === 'reload') poked = true;
+                        if (frame.event !== 'delta' || cancelled) return;
+                        let delta = null;
+                        try {
+                            delta = JSON.parse(frame.data);
+                        } catch (e) {
+                            delta = null;
+                        }
+                        // Дельта без обратного запроса; не вышло — обычная перечитка.
+                        applyDeltaRef.current(delta, () => { poked = true; });
+                    });
                     if (poked && !pokeTimer) {
                         /* Свёрнутое окно читает СРАЗУ, без джиттера. Chrome
                            прижимает таймеры фоновой вкладки до одного
@@ -533,6 +597,8 @@ export default function NotificationsBell({ apiBaseUrl, user, getHeaders, onNavi
         setItems((prev) => (prev.some((item) => item.source === source)
             ? prev.filter((item) => item.source !== source)
             : prev));
+        // Иначе дельта по соседнему источнику вернула бы погашенное на миг.
+        itemsRef.current = itemsRef.current.filter((item) => item.source !== source);
     }, [readSource?.source, readSource?.nonce]);
 
     const close = useCallback(() => {
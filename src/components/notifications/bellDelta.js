@@ -0,0 +1,38 @@
+/* Режим дельт канала колокола (/api/notifications/stream?mode=delta).
+
+   Сервер присылает в потоке пересчитанные источники: счётчики целиком, а
+   элементы — только изменившихся источников. Элементы прочих источников
+   остаются прежними, и общий порядок обязан совпасть с тем, что отдала бы
+   полная сводка: группы в порядке SOURCES (сервер присылает его в order),
+   внутри группы — порядок источника, просроченное наверх. */
+export function applyBellDelta(items, delta) {
+  const changed = new Set(delta?.sources || []);
+  const order = new Map((delta?.order || []).map((source, index) => [source, index]));
+  const rank = (item) => (order.has(item.source) ? order.get(item.source) : order.size);
+  const merged = (items || [])
+    .filter((item) => !changed.has(item.source))
+    .concat(Array.isArray(delta?.items) ? delta.items : []);
+  // Array.prototype.sort устойчива: внутри группы порядок источника сохраняется.
+  merged.sort((a, b) => rank(a) - rank(b));
+  merged.sort((a, b) => (a.tone !== 'warning') - (b.tone !== 'warning'));
+  return merged;
+}
+
+/* Один SSE-кадр («id:», «event:», «data:» и комментарии) в объект. */
+export function parseSseFrame(chunk) {
+  const frame = { id: null, event: null, data: '', comment: null };
+  const data = [];
+  for (const line of String(chunk || '').split('\n')) {
+    if (line.startsWith(':')) {
+      frame.comment = line.slice(1).trim();
+    } else if (line.startsWith('id:')) {
+      frame.id = line.slice(3).trim();
+    } else if (line.startsWith('event:')) {
+      frame.event = line.slice(6).trim();
+    } else if (line.startsWith('data:')) {
+      data.push(line.slice(5).replace(/^ /, ''));
+    }
+  }
+  frame.data = data.join('\n');
+  return frame;
+}
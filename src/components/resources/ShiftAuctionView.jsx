@@ -46,6 +46,8 @@ import {
   filterOperationalShiftAuctionOperators,
   getShiftAuctionOperatorStatusLabel,
   isActiveShiftAuctionOperator,
+  mergeShiftAuctionDeltaLots,
+  mergeShiftAuctionDeltaWorkloads,
   normalizeShiftAuctionOperatorId as normalizeOperatorId,
   normalizeShiftAuctionOperators,
   shouldHydrateShiftAuctionDraft,
@@ -4105,7 +4107,19 @@ const ShiftAuctionView = ({ user, operators = [], apiBaseUrl, withAccessTokenHea
     });
     setNotifyPostClaimEnabled(Boolean(safe.notify_post_claim_enabled));
     serverTimeGroupsRef.current = Array.isArray(safe.time_groups) ? safe.time_groups : [];
-    if (!isStaleRealtime) {
+    if (!isStaleRealtime && safe.delta) {
+      // Delta snapshot (`since=`): only the lots and workloads that changed after
+      // the version we already hold. Everything else stays as it is.
+      setLots((currentLots) => mergeShiftAuctionDeltaLots(currentLots, safe.lots, safe.removed_lot_ids));
+      setParticipantWorkloads((current) => mergeShiftAuctionDeltaWorkloads(current, safe.participant_workloads));
+      setMyDayOffs(Array.isArray(safe.my_day_offs) ? safe.my_day_offs.filter(Boolean) : []);
+      setMyBlockedDates(Array.isArray(safe.my_blocked_dates) ? safe.my_blocked_dates.filter((item) => (typeof item === 'string' ? item : item?.date)) : []);
+      setMyWorkShifts(Array.isArray(safe.my_work_shifts) ? safe.my_work_shifts : []);
+      setClaimJournal(Array.isArray(safe.claim_journal) ? safe.claim_journal : []);
+      lastAppliedSnapshotEventIdRef.current = Math.max(lastAppliedSnapshotEventIdRef.current, incomingEventId);
+      lastEventIdRef.current = Math.max(lastEventIdRef.current, incomingEventId);
+      setLastEventId((current) => Math.max(current, incomingEventId));
+    } else if (!isStaleRealtime) {
       setLots(Array.isArray(safe.lots) ? safe.lots : []);
       setMyDayOffs(Array.isArray(safe.my_day_offs) ? safe.my_day_offs.filter(Boolean) : []);
       setMyBlockedDates(Array.isArray(safe.my_blocked_dates) ? safe.my_blocked_dates.filter((item) => (typeof item === 'string' ? item : item?.date)) : []);
@@ -4196,7 +4210,11 @@ const ShiftAuctionView = ({ user, operators = [], apiBaseUrl, withAccessTokenHea
     if (!silent) setIsLoading(true);
     try {
       const extraHeaders = snapshotEtagRef.current ? { 'If-None-Match': snapshotEtagRef.current } : {};
+      // Background refreshes ask only for what changed since the snapshot we hold;
+      // the server answers with a full snapshot whenever a delta cannot cover it.
+      const sinceVersion = silent ? lastAppliedSnapshotEventIdRef.current : 0;
       const response = await axios.get(`${apiRoot}/api/shift_auction/test_snapshot`, {
+        params: sinceVersion > 0 ? { since: sinceVersion } : undefined,
         headers: buildHeaders(extraHeaders),
         validateStatus: (status) => (status >= 200 && status < 300) || status === 304
       });
@@ -156,3 +156,34 @@ export const shouldHydrateShiftAuctionDraft = ({
   if (!snapshotUpdatedAt) return false;
   return isTimestampAtOrAfter(snapshotUpdatedAt, pendingSavedAt);
 };
+
+export const mergeShiftAuctionDeltaLots = (currentLots, changedLots, removedLotIds) => {
+  const changedById = new Map((Array.isArray(changedLots) ? changedLots : []).map((lot) => [Number(lot?.id), lot]));
+  const removed = new Set((Array.isArray(removedLotIds) ? removedLotIds : []).map(Number));
+  const merged = (Array.isArray(currentLots) ? currentLots : [])
+    .filter((lot) => !removed.has(Number(lot?.id)))
+    .map((lot) => {
+      const lotId = Number(lot?.id);
+      if (!changedById.has(lotId)) return lot;
+      const changed = changedById.get(lotId);
+      changedById.delete(lotId);
+      return changed;
+    });
+  if (!changedById.size) return merged;
+  // New lots (added by a manager or self-scheduled): keep the server's order.
+  return [...merged, ...changedById.values()].sort((left, right) => (
+    String(left?.shift_date || '').localeCompare(String(right?.shift_date || ''))
+    || String(left?.start_time || '').localeCompare(String(right?.start_time || ''))
+    || Number(left?.id || 0) - Number(right?.id || 0)
+  ));
+};
+
+export const mergeShiftAuctionDeltaWorkloads = (currentWorkloads, changedWorkloads) => {
+  const changedByOperator = new Map(
+    (Array.isArray(changedWorkloads) ? changedWorkloads : []).map((item) => [Number(item?.operator_id), item])
+  );
+  if (!changedByOperator.size) return currentWorkloads;
+  return (Array.isArray(currentWorkloads) ? currentWorkloads : []).map((item) => (
+    changedByOperator.get(Number(item?.operator_id)) || item
+  ));
+};
@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""Асинхронный шлюз SSE: лента аукциона смен и колокол на одном asyncio-цикле.
+
+Зачем. /api/shift_auction/test_events и /api/notifications/stream под waitress
+держат по нити на открытую вкладку, а нитей на весь портал ~96 (WAITRESS_THREADS).
+Отсюда BELL_STREAM_LIMIT у колокола, а во время живого аукциона каждый участник
+занимает нить, которую не получит обычный запрос. Шлюз обслуживает те же потоки
+корутинами: тысяча открытых соединений — тысяча корутин на одной нити.
+
+Что НЕ меняется. Слушатели LISTEN и буферы в памяти остаются прежними (см.
+_run_shift_auction_pg_listener и notifications/realtime.py): шлюз — ещё один
+потребитель тех же буферов, а не второй слушатель. На каждый источник одна
+нить-«насос» ждёт его условную переменную и будит цикл через
+call_soon_threadsafe; соединения в цикле читают буфер сами. Семантика
+возобновления та же, что у маршрутов Flask: курсор из ?after= или заголовка
+Last-Event-ID, отставшего дальше окна буфера один раз догоняем из базы.
+
+Авторизация. Шлюз о JWT, куках и ролях не знает: authorize() прогоняет запрос
+через конвейер Flask (before_request, require_api_key, проверка доступа
+маршрута, after_request) в маленьком пуле нитей и возвращает ответ целиком.
+Отказ (401, 403, preflight OPTIONS) шлюз отдаёт как есть; при допуске берёт из
+него только Set-Cookie (ротация токена) и CORS-заголовки.
+
+Развёртывание. Снаружи у сервиса один порт (PORT на Render), и фронт ходит на
+тот же ${API_BASE_URL}/api/..., что и раньше. Поэтому в боевом режиме
+(SSE_GATEWAY_FRONT) шлюз сам занимает публичный порт, а waitress уходит на
+127.0.0.1: два пути потоков шлюз обслуживает у себя, всё остальное потоково
+проксирует в waitress (upstream) как есть — тела, статусы, заголовки, сжатие.
+Отдельный порт (SSE_GATEWAY_PORT) годится только там, где его можно открыть
+наружу, и тогда маршруты waitress остаются запасным путём. Модуль не
+импортирует bot_schedule2 — всё, что нужно от монолита, приходит аргументами
+SseGateway.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+from yarl import URL
+
+from notifications import realtime
+
+STREAM_SHIFT_AUCTION = 'shift_auction'
+STREAM_BELL = 'bell'
+STREAM_PATHS = {
+    STREAM_SHIFT_AUCTION: '/api/shift_auction/test_events',
+    STREAM_BELL: '/api/notifications/stream',
+}
+
+SHIFT_AUCTION_HEARTBEAT_SECONDS = 15
+# Насос ждёт сигнал источника с таймаутом, чтобы замечать остановку шлюза.
+PUMP_WAIT_SECONDS = 5
+# Из ответа Flask при допуске переносим только эти заголовки: тело и статус
+# потоку не нужны, а куки ротации и CORS — нужны.
+_FORWARDED_HEADER_PREFIXES = ('set-cookie', 'access-control-', 'vary')
+# Заголовки одного перехода (RFC 9110, 7.6.1) прокси не передаёт ни туда, ни обратно.
+# Host и Content-Length остаются: Flask строит ссылки от Host, а с длиной тело
+# уходит в waitress без chunked.
+_HOP_BY_HOP_HEADERS = frozenset((
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'proxy-connection', 'te', 'trailer', 'transfer-encoding', 'upgrade',
+))
+UPSTREAM_CHUNK_BYTES = 64 * 1024
+UPSTREAM_CONNECT_SECONDS = 10
+
+
+@dataclass
+class AuthVerdict:
+    """Итог authorize(): user_id при допуске, иначе ответ Flask, который отдаём клиенту."""
+    user_id: Optional[int]
+    status: int = 200
+    headers: List[Tuple[str, str]] = field(default_factory=list)
+    body: bytes = b''
+    # Строка пользователя из авторизации — для дельт колокола: периметр
+    # зрителя считается по ней, как в маршруте waitress.
+    requester: Optional[tuple] = None
+
+
+def resume_event_id(after, last_event_id):
+    """Курсор возобновления: ?after= главнее, Last-Event-ID — для EventSource после обрыва."""
+    for raw in (after, last_event_id):
+        try:
+            value = int(raw or 0)
+        except (TypeError, ValueError):
+            continue
+        if value > 0:
+            return value
+    return 0
+
+
+def _sse_event(event):
+    return (
+        f"id: {event['id']}\n"
+        f"event: {event['event_type']}\n"
+        f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+    ).encode('utf-8')
+
+
+def _bell_reload_frame(seq):
+    return f"id: {realtime.cursor_id(seq)}\nevent: reload\ndata: {{}}\n\n".encode('ascii')
+
+
+class _Broadcast:
+    """Поколение источника: растёт на каждый сигнал, ждущие корутины просыпаются разом.
+
+    Живёт только в цикле шлюза; из нитей трогается через call_soon_threadsafe.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._event = asyncio.Event()
+
+    def bump(self):
+        self.version += 1
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    async def wait(self, seen_version, timeout):
+        """True — было новое поколение после seen_version, False — истёк таймаут."""
+        if self.version != seen_version:
+            return True
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout=max(0.0, timeout))
+        except asyncio.TimeoutError:
+            return self.version != seen_version
+        return True
+
+
+class SseGateway:
+    def __init__(self, *, authorize, auction_read, auction_catchup, auction_signal,
+                 auction_wait, auction_ensure_listener, bell_listen_connect=None,
+                 bell_delta_frame=None, max_streams=5000, auth_workers=4,
+                 auction_heartbeat_seconds=SHIFT_AUCTION_HEARTBEAT_SECONDS,
+                 bell_heartbeat_seconds=None, pump_wait_seconds=PUMP_WAIT_SECONDS,
+                 upstream=None):
+        self._authorize = authorize
+        self._auction_read = auction_read
+        self._auction_catchup = auction_catchup
+        self._auction_signal = auction_signal
+        self._auction_wait = auction_wait
+        self._auction_ensure_listener = auction_ensure_listener
+        self._bell_listen_connect = bell_listen_connect
+        # bell_delta_frame(user_id, requester, changes, limit, seq) -> str — кадр
+        # режима дельт (notifications.routes.delta_frame). Без него ?mode=delta
+        # молча остаётся на тычках reload.
+        self._bell_delta_frame = bell_delta_frame
+        self._max_streams = int(max_streams)
+        self._auction_heartbeat = float(auction_heartbeat_seconds)
+        self._bell_heartbeat = float(bell_heartbeat_seconds or realtime.HEARTBEAT_SECONDS)
+        self._pump_wait = float(pump_wait_seconds)
+        # Авторизация и догонка из базы — блокирующие вызовы монолита; им своя
+        # небольшая очередь, чтобы лавина переподключений не заняла нити waitress.
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(auth_workers)),
+                                            thread_name_prefix='sse-gateway')
+        self._loop = None
+        self._broadcasts = {}
+        self._stopped = threading.Event()
+        self._active = {STREAM_SHIFT_AUCTION: 0, STREAM_BELL: 0}
+        self._bell_listener_ready = False
+        # upstream — 'http://127.0.0.1:8081', куда уходят все прочие запросы, когда
+        # шлюз стоит на публичном порту. None — шлюз отвечает только на потоки.
+        self._upstream = upstream.rstrip('/') if upstream else None
+        self._upstream_session = None
+
+    # ── Насосы: по нити на источник, а не на соединение ──────────────────
+
+    def _pump(self, name, current, wait_change):
+        token = current()
+        while not self._stopped.is_set():
+            try:
+                fresh = wait_change(token, self._pump_wait)
+            except Exception:
+                logging.exception('SSE-шлюз: насос %s упал, повтор', name)
+                time.sleep(1)
+                continue
+            if fresh != token and not self._stopped.is_set():
+                token = fresh
+                self._loop.call_soon_threadsafe(self._broadcasts[name].bump)
+
+    def _start_pumps(self, loop):
+        self._loop = loop
+        self._stopped.clear()
+        self._broadcasts = {STREAM_SHIFT_AUCTION: _Broadcast(), STREAM_BELL: _Broadcast()}
+        pumps = (
+            (STREAM_SHIFT_AUCTION, self._auction_signal, self._auction_wait),
+            (STREAM_BELL, realtime.current_seq, realtime.wait_for_seq),
+        )
+        for name, current, wait_change in pumps:
+            threading.Thread(
+                target=self._pump,
+                args=(name, current, wait_change),
+                daemon=True,
+                name=f'sse-gateway-pump-{name}',
+            ).start()
+
+    async def _on_startup(self, app):
+        self._start_pumps(asyncio.get_running_loop())
+        if self._upstream:
+            # Без общего таймаута: выгрузки и запасные потоки waitress длинные, их
+            # время ограничивает channel_timeout самой waitress. Сжатое тело не
+            # распаковываем — клиент получает те же байты, что отдала waitress.
+            self._upstream_session = aiohttp.ClientSession(
+                auto_decompress=False,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=UPSTREAM_CONNECT_SECONDS),
+                connector=aiohttp.TCPConnector(limit=0),
+            )
+
+    async def _on_cleanup(self, app):
+        self._stopped.set()
+        if self._upstream_session is not None:
+            await self._upstream_session.close()
+
+    # ── Общая часть обработчиков ────────────────────────────────────────
+
+    async def _admit(self, request, stream):
+        """(AuthVerdict, готовый ответ-отказ или None)."""
+        loop = asyncio.get_running_loop()
+        try:
+            verdict = await loop.run_in_executor(
+                self._executor, self._authorize, stream, request.method,
+                list(request.headers.items()), request.query_string, request.remote)
+        except Exception:
+            logging.exception('SSE-шлюз: авторизация %s упала', stream)
+            return None, web.json_response({"error": "Internal server error"}, status=500)
+        if verdict.user_id is None:
+            response = web.Response(status=verdict.status, body=verdict.body)
+            for name, value in verdict.headers:
+                if name.lower() not in ('content-length', 'transfer-encoding'):
+                    response.headers.add(name, value)
+            return verdict, response
+        if self._active[stream] >= self._max_streams:
+            response = web.json_response({"status": "busy"}, status=503)
+            response.headers['Retry-After'] = '300'
+            return verdict, response
+        return verdict, None
+
+    async def _open_stream(self, request, verdict):
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+        for name, value in verdict.headers:
+            if name.lower().startswith(_FORWARDED_HEADER_PREFIXES):
+                response.headers.add(name, value)
+        await response.prepare(request)
+        await response.write(f": connected {int(time.time())}\n\n".encode('ascii'))
+        return response
+
+    # ── Лента аукциона смен ─────────────────────────────────────────────
+
+    async def handle_shift_auction(self, request):
+        verdict, refusal = await self._admit(request, STREAM_SHIFT_AUCTION)
+        if refusal is not None:
+            return refusal
+        last_event_id = resume_event_id(request.query.get('after'), request.headers.get('Last-Event-ID'))
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._auction_ensure_listener)
+        broadcast = self._broadcasts[STREAM_SHIFT_AUCTION]
+
+        self._active[STREAM_SHIFT_AUCTION] += 1
+        try:
+            response = await self._open_stream(request, verdict)
+            heartbeat_at = time.monotonic()
+            while True:
+                # Поколение снимаем ДО чтения буфера: событие, опубликованное
+                # между чтением и ожиданием, сдвинет его, и ожидание не уснёт.
+                seen_version = broadcast.version
+                events, covered, _signal_id, buffer_floor_id = self._auction_read(last_event_id)
+                if not covered:
+                    # Клиент отстал дальше окна буфера: разовая догонка из базы
+                    # в пуле шлюза, дальше снова из памяти.
+                    events = await loop.run_in_executor(self._executor, self._auction_catchup, last_event_id)
+                    if not events and buffer_floor_id is not None:
+                        last_event_id = max(last_event_id, int(buffer_floor_id) - 1)
+                        continue
+                if events:
+                    for event in events:
+                        last_event_id = max(last_event_id, int(event.get('id') or 0))
+                        await response.write(_sse_event(event))
+                    heartbeat_at = time.monotonic()
+                    continue
+                remaining = self._auction_heartbeat - (time.monotonic() - heartbeat_at)
+                if remaining > 0 and await broadcast.wait(seen_version, remaining):
+                    continue
+                await response.write(f": heartbeat {int(time.time())}\n\n".encode('ascii'))
+                heartbeat_at = time.monotonic()
+        finally:
+            self._active[STREAM_SHIFT_AUCTION] -= 1
+
+    # ── Колокол ─────────────────────────────────────────────────────────
+
+    async def handle_bell(self, request):
+        verdict, refusal = await self._admit(request, STREAM_BELL)
+        if refusal is not None:
+            return refusal
+        if self._bell_listen_connect is None:
+            return web.json_response({"error": "Реалтайм-канал не подключён"}, status=503)
+        if not self._bell_listener_ready:
+            realtime.ensure_listener(self._bell_listen_connect)
+            self._bell_listener_ready = True
+        user_id = int(verdict.user_id)
+        broadcast = self._broadcasts[STREAM_BELL]
+        if self._bell_delta_frame is not None and request.query.get('mode') == 'delta':
+            return await self._stream_bell_deltas(request, verdict, user_id, broadcast)
+
+        self._active[STREAM_BELL] += 1
+        try:
+            response = await self._open_stream(request, verdict)
+            cursor_seq = realtime.current_seq()
+            while True:
+                seen_version = broadcast.version
+                poked, cursor_seq = realtime.poll_tick(cursor_seq, user_id)
+                if poked:
+                    await response.write(b"event: reload\ndata: {}\n\n")
+                    continue
+                if await broadcast.wait(seen_version, self._bell_heartbeat):
+                    continue
+                await response.write(f": heartbeat {int(time.time())}\n\n".encode('ascii'))
+        finally:
+            self._active[STREAM_BELL] -= 1
+
+    async def _stream_bell_deltas(self, request, verdict, user_id, broadcast):
+        """Режим дельт колокола — см. notifications/realtime.py и routes.py.
+
+        Дельту собирает монолит (collect по кешу сводки) в пуле шлюза: всплеск
+        после широковещательного тычка упирается в auth_workers, а не в пул
+        соединений базы.
+        """
+        raw_after = request.query.get('after') or request.headers.get('Last-Event-ID')
+        # Курсор 0 законен (кольцо ещё пусто), поэтому «нет курсора» — только его отсутствие.
+        after = resume_event_id(raw_after, None) if raw_after else None
+        limit = request.query.get('limit')
+        loop = asyncio.get_running_loop()
+
+        self._active[STREAM_BELL] += 1
+        try:
+            response = await self._open_stream(request, verdict)
+            cursor_seq, covered = realtime.resume_seq(after)
+            if not covered:
+                await response.write(_bell_reload_frame(cursor_seq))
+            while True:
+                seen_version = broadcast.version
+                changes, cursor_seq = realtime.poll_changes(cursor_seq, user_id)
+                if changes is not None and changes.sources is None:
+                    await response.write(_bell_reload_frame(cursor_seq))
+                    continue
+                if changes is not None:
+                    frame = await loop.run_in_executor(
+                        self._executor, self._bell_delta_frame,
+                        user_id, verdict.requester, changes, limit, cursor_seq)
+                    await response.write(frame.encode('utf-8'))
+                    continue
+                if await broadcast.wait(seen_version, self._bell_heartbeat):
+                    continue
+                await response.write(f": heartbeat {int(time.time())}\n\n".encode('ascii'))
+        finally:
+            self._active[STREAM_BELL] -= 1
+
+    # ── Всё остальное — в waitress ─────────────────────────────────────
+
+    async def handle_upstream(self, request):
+        """Прозрачный прокси в waitress: тело запроса и ответа идут потоком.
+
+        X-Forwarded-For дописывается адресом, с которого пришли к шлюзу, —
+        _client_ip() монолита по-прежнему берёт первый адрес цепочки.
+        """
+        headers = [(name, value) for name, value in request.headers.items()
+                   if name.lower() not in _HOP_BY_HOP_HEADERS and name.lower() != 'x-forwarded-for']
+        forwarded_for = ', '.join(filter(None, (request.headers.get('X-Forwarded-For'), request.remote)))
+        if forwarded_for:
+            headers.append(('X-Forwarded-For', forwarded_for))
+        response = None
+        try:
+            async with self._upstream_session.request(
+                request.method,
+                URL(self._upstream + request.raw_path, encoded=True),
+                headers=headers,
+                data=request.content if request.body_exists else None,
+                allow_redirects=False,
+            ) as upstream:
+                response = web.StreamResponse(status=upstream.status, reason=upstream.reason)
+                for name, value in upstream.headers.items():
+                    if name.lower() not in _HOP_BY_HOP_HEADERS:
+                        response.headers.add(name, value)
+                await response.prepare(request)
+                async for chunk in upstream.content.iter_chunked(UPSTREAM_CHUNK_BYTES):
+                    await response.write(chunk)
+                await response.write_eof()
+                return response
+        except aiohttp.ClientConnectionError:
+            if response is not None and response.prepared:
+                raise  # заголовки уже ушли — остаётся только оборвать соединение
+            logging.warning('SSE-шлюз: waitress недоступна для %s %s', request.method, request.path)
+            return web.json_response({"error": "Upstream unavailable"}, status=502)
+
+    # ── Сборка и запуск ─────────────────────────────────────────────────
+
+    def snapshot(self):
+        return {"active_streams": dict(self._active), "max_streams": self._max_streams}
+
+    def make_app(self):
+        app = web.Application()
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        for path, handler in (
+            (STREAM_PATHS[STREAM_SHIFT_AUCTION], self.handle_shift_auction),
+            (STREAM_PATHS[STREAM_BELL], self.handle_bell),
+        ):
+            app.router.add_route('GET', path, handler)
+            app.router.add_route('OPTIONS', path, handler)
+        if self._upstream:
+            # Маршруты потоков заведены выше и матчатся первыми.
+            app.router.add_route('*', '/{tail:.*}', self.handle_upstream)
+        return app
+
+    def start_in_thread(self, host, port):
+        """Поднять шлюз на своей нити со своим циклом — у бота aiogram цикл свой."""
+        def _serve():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            runner = web.AppRunner(self.make_app())
+            loop.run_until_complete(runner.setup())
+            loop.run_until_complete(web.TCPSite(runner, host, int(port)).start())
+            logging.info('SSE-шлюз слушает %s:%s', host, port)
+            loop.run_forever()
+
+        thread = threading.Thread(target=_serve, daemon=True, name='sse-gateway')
+        thread.start()
+        return thread
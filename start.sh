@@ -1,2 +1,6 @@
 #!/bin/bash
+# Снаружи у сервиса один порт (PORT). SSE-шлюз занимает его сам и проксирует
+# всё, кроме лент аукциона и колокола, в waitress на 127.0.0.1 (sse_gateway.py).
+# SSE_GATEWAY_FRONT=0 в окружении сервиса возвращает waitress на PORT без шлюза.
+export SSE_GATEWAY_FRONT="${SSE_GATEWAY_FRONT:-1}"
 python bot_schedule2.py
@@ -2,6 +2,7 @@ import test from 'node:test';
 import assert from 'node:assert/strict';
 
 import { createCoalescedReload } from '../src/components/notifications/coalescedReload.js';
+import { applyBellDelta, parseSseFrame } from '../src/components/notifications/bellDelta.js';
 
 const deferred = () => {
   let resolve;
@@ -58,3 +59,37 @@ test('после ошибки gate освобождается для следу
   await reload();
   assert.equal(calls, 2);
 });
+
+const item = (source, id, tone = 'default') => ({ source, id, tone });
+
+test('дельта заменяет элементы только своих источников и держит порядок сводки', () => {
+  const order = ['wiki_ack', 'tasks', 'events', 'four_you'];
+  const before = [item('wiki_ack', 1), item('tasks', 2), item('events', 3), item('four_you', 4)];
+  const next = applyBellDelta(before, {
+    sources: ['events'],
+    order,
+    items: [item('events', 5), item('events', 6)],
+  });
+  assert.deepEqual(next.map((entry) => entry.id), [1, 2, 5, 6, 4]);
+  assert.deepEqual(before.map((entry) => entry.id), [1, 2, 3, 4], 'исходный список не тронут');
+});
+
+test('просроченное из дельты поднимается наверх, источник без элементов гаснет', () => {
+  const order = ['wiki_ack', 'tasks', 'events'];
+  const before = [item('wiki_ack', 1), item('tasks', 2), item('events', 3)];
+  const next = applyBellDelta(before, {
+    sources: ['events', 'tasks'],
+    order,
+    items: [item('events', 7, 'warning')],
+  });
+  assert.deepEqual(next.map((entry) => entry.id), [7, 1]);
+});
+
+test('кадр SSE разбирается на id, событие, данные и комментарий', () => {
+  assert.deepEqual(
+    parseSseFrame('id: 12\nevent: delta\ndata: {"seq": 12}'),
+    { id: '12', event: 'delta', data: '{"seq": 12}', comment: null },
+  );
+  assert.equal(parseSseFrame(': connected 1700000000').comment, 'connected 1700000000');
+  assert.equal(parseSseFrame('event: reload\ndata: {}').id, null);
+});
@@ -3,6 +3,8 @@ import assert from 'node:assert/strict';
 
 import {
   filterOperationalShiftAuctionOperators,
+  mergeShiftAuctionDeltaLots,
+  mergeShiftAuctionDeltaWorkloads,
   normalizeShiftAuctionOperators,
   shouldHydrateShiftAuctionDraft,
 } from '../src/components/resources/shiftAuctionParticipants.js';
@@ -109,3 +111,33 @@ test('snapshot hydrates only a clean draft and never crosses a pending save cuto
     snapshotUpdatedAt: '2026-07-30T12:00:00.123100',
   }), false);
 });
+
+test('delta snapshot replaces changed lots, drops removed ones and keeps server order', () => {
+  const current = [
+    { id: 1, shift_date: '2026-10-20', start_time: '09:00', status: 'open' },
+    { id: 2, shift_date: '2026-10-20', start_time: '12:00', status: 'open' },
+    { id: 3, shift_date: '2026-10-21', start_time: '09:00', status: 'open' },
+  ];
+  const merged = mergeShiftAuctionDeltaLots(
+    current,
+    [
+      { id: 2, shift_date: '2026-10-20', start_time: '12:00', status: 'claimed' },
+      { id: 4, shift_date: '2026-10-20', start_time: '10:00', status: 'open' },
+    ],
+    [3],
+  );
+
+  assert.deepEqual(merged.map((lot) => lot.id), [1, 4, 2]);
+  assert.equal(merged.find((lot) => lot.id === 2)?.status, 'claimed');
+  assert.equal(merged[0], current[0]);
+});
+
+test('delta workloads replace only the operators the server sent', () => {
+  const current = [{ operator_id: 5, hours: 10 }, { operator_id: 6, hours: 4 }];
+
+  assert.equal(mergeShiftAuctionDeltaWorkloads(current, []), current);
+  assert.deepEqual(
+    mergeShiftAuctionDeltaWorkloads(current, [{ operator_id: 6, hours: 8 }]),
+    [{ operator_id: 5, hours: 10 }, { operator_id: 6, hours: 8 }],
+  );
+});
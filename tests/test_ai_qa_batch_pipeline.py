@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Конвейер batch_eval: транскрипты уходят в батчи порциями, пока стадия ASR ещё
+идёт; незавершённые порции продолжаются при перезапуске; разбор результатов
+отмечает каждый субъект и после обрыва не финализирует его повторно."""
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from call_qa import batch_eval
+
+
+def _call(i):
+    return {"id": i, "direction_id": 74, "audio_path": f"b/{i}.mp3"}
+
+
+def _manifest(*ids):
+    return {"version": 2, "created_at": "2026-10-17T00:00:00+00:00", "model": "m",
+            "entries": {f"call-{i}": {"call": _call(i), "subject_kind": "call",
+                                      "transcript_cache_id": i}
+                        for i in ids}}
+
+
+class _Harness:
+    """Подменяет отправку и разбор батча: записывает, какие порции ушли и когда."""
+
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self.submitted, self.first_submitted = [], threading.Event()
+
+    def submit(self, calls, transcripts, chunk_dir, get_dir):
+        self.submitted.append((os.path.basename(chunk_dir), [c["id"] for c in calls]))
+        self.first_submitted.set()
+        return f"batch-{len(self.submitted)}"
+
+    def finish(self, chunk_dir, batch_id, transcripts, get_dir):
+        ids = dict(self.submitted)[os.path.basename(chunk_dir)]
+        return {"ok": len(ids), "errored": 0, "no_score": 0, "pairs": [(80.0, 75.0)],
+                "usage": {"input": 10 * len(ids), "output": 1, "cache_write": 0, "cache_read": 0}}
+
+    def run(self, produce, **kwargs):
+        with mock.patch.object(batch_eval, "submit_batch", side_effect=self.submit), \
+             mock.patch.object(batch_eval, "_finish_chunk", side_effect=self.finish), \
+             mock.patch.object(batch_eval, "_dir_cache", return_value=None), \
+             mock.patch.object(batch_eval, "log"):
+            return batch_eval.pipeline(self.workdir, produce, linger_s=3600, **kwargs)
+
+
+class PipelineTests(unittest.TestCase):
+    def test_batches_are_submitted_while_transcripts_are_still_produced(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            harness = _Harness(workdir)
+            overlapped = []
+
+            def produce(on_ready):
+                for i in (1, 2):
+                    on_ready(_call(i), {"call_id": i})
+                # третий транскрипт появится только после отправки первой порции
+                overlapped.append(harness.first_submitted.wait(timeout=10))
+                for i in (3, 4, 5):
+                    on_ready(_call(i), {"call_id": i})
+
+            stats = harness.run(produce, batch_size=2, open_batches=2)
+        self.assertEqual(overlapped, [True])
+        self.assertEqual(harness.submitted, [("0001", [1, 2]), ("0002", [3, 4]), ("0003", [5])])
+        self.assertEqual(stats["ok"], 5)
+        self.assertEqual(stats["usage"]["input"], 50)
+        self.assertEqual(len(stats["pairs"]), 3)
+        self.assertEqual(stats["failed_batches"], 0)
+
+    def test_restart_resumes_open_chunks_and_does_not_resubmit_their_subjects(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            chunk = os.path.join(workdir, "batches", "0001")
+            os.makedirs(chunk)
+            batch_eval._write_manifest(chunk, _manifest(1, 2))
+            harness = _Harness(workdir)
+
+            def produce(on_ready):
+                for i in (1, 2, 3):
+                    on_ready(_call(i), {"call_id": i})
+
+            harness.run(produce, batch_size=10)
+        self.assertEqual(harness.submitted, [("0001", []), ("0002", [3])])
+
+    def test_failed_chunk_is_reported_and_others_still_finish(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            harness = _Harness(workdir)
+            finish = harness.finish
+
+            def flaky(chunk_dir, *args):
+                if chunk_dir.endswith("0001"):
+                    raise RuntimeError("results unavailable")
+                return finish(chunk_dir, *args)
+
+            harness.finish = flaky
+
+            def produce(on_ready):
+                for i in (1, 2, 3, 4):
+                    on_ready(_call(i), {"call_id": i})
+
+            stats = harness.run(produce, batch_size=2)
+        self.assertEqual(stats["failed_batches"], 1)
+        self.assertEqual(stats["ok"], 2)
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+    def raise_for_status(self):
+        pass
+
+
+class ItemCheckpointTests(unittest.TestCase):
+    def test_torn_last_line_is_ignored(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            batch_eval._mark_done(workdir, "call-1", _call(1))
+            with open(batch_eval._done_path(workdir), "a", encoding="utf-8") as fh:
+                fh.write('{"custom_id": "call-')
+            self.assertEqual(batch_eval._done_items(workdir),
+                             [{"custom_id": "call-1", "subject": "call:1"}])
+
+    def test_published_items_are_not_finalized_again(self):
+        results = "\n".join(json.dumps({"custom_id": f"call-{i}",
+                                        "result": {"type": "succeeded", "message": {}}})
+                            for i in (1, 2))
+        with tempfile.TemporaryDirectory() as workdir:
+            batch_eval._write_manifest(workdir, _manifest(1, 2))
+            with open(os.path.join(workdir, "batch_id.txt"), "w") as fh:
+                fh.write("batch-1")
+            for i in (1, 2):
+                batch_eval._mark_done(workdir, f"call-{i}", _call(i))
+            with mock.patch.object(batch_eval.httpx, "get", return_value=_Response(results)), \
+                 mock.patch.object(batch_eval.llm, "_headers", return_value={}), \
+                 mock.patch.object(batch_eval.runtime_store, "distributed_call_lock",
+                                   side_effect=AssertionError("finalized twice")), \
+                 mock.patch.object(batch_eval, "log"):
+                stats = batch_eval.process_results({"results_url": "https://r"}, [], {},
+                                                   workdir, None)
+            self.assertEqual(stats["ok"], 0)
+            self.assertEqual(os.listdir(workdir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
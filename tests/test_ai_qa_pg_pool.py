@@ -0,0 +1,223 @@
+"""Пул соединений call_qa (call_qa/pg_pool.py): переиспользование, уборка, живость, предел.
+
+Соединения поддельные: хранят режим сессии и статус транзакции так же, как
+psycopg2, и считают запросы, поэтому тесты идут без Postgres.
+"""
+import threading
+import unittest
+from types import SimpleNamespace
+
+import psycopg2
+import psycopg2.extensions
+
+from call_qa import config
+from call_qa.pg_pool import ConnectionPool
+
+IDLE = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+INTRANS = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+
+
+class _Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        if self.conn.broken:
+            self.conn.closed = 2
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.conn.executed.append(sql)
+        if not self.conn.autocommit:
+            self.conn.info.transaction_status = INTRANS
+
+    def close(self):
+        pass
+
+
+class _Raw:
+    opened = 0
+
+    def __init__(self):
+        type(self).opened += 1
+        self.closed = 0
+        self.broken = False
+        self.autocommit = False
+        self.readonly = None
+        self.encoding = None
+        self.executed = []
+        self.rollbacks = 0
+        self.info = SimpleNamespace(transaction_status=IDLE)
+
+    def set_client_encoding(self, encoding):
+        self.encoding = encoding
+
+    def set_session(self, readonly=None, autocommit=None):
+        self.readonly, self.autocommit = readonly, autocommit
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def commit(self):
+        self.info.transaction_status = IDLE
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _pool(**options):
+    raws = []
+
+    def connect():
+        raw = _Raw()
+        raws.append(raw)
+        return raw
+
+    options.setdefault("clock", _Clock())
+    return ConnectionPool("test", connect, **options), raws
+
+
+class ReuseTests(unittest.TestCase):
+    def test_close_returns_the_connection_and_settings_are_applied_once(self):
+        pool, raws = _pool(autocommit=True, readonly=True)
+        for _ in range(3):
+            conn = pool.connection()
+            conn.cursor().execute("SELECT 1")
+            conn.close()
+        self.assertEqual(len(raws), 1)
+        self.assertEqual((raws[0].encoding, raws[0].readonly, raws[0].autocommit),
+                         ("UTF8", True, True))
+        self.assertEqual(pool.stats()["reused"], 2)
+
+    def test_closed_proxy_refuses_further_use(self):
+        pool, _raws = _pool()
+        conn = pool.connection()
+        conn.close()
+        conn.close()  # повторный close() безвреден, как у psycopg2
+        self.assertTrue(conn.closed)
+        with self.assertRaises(psycopg2.InterfaceError):
+            conn.cursor()
+
+    def test_forgotten_close_still_returns_the_slot(self):
+        pool, raws = _pool(max_size=1, acquire_timeout_seconds=0.1)
+        conn = pool.connection()
+        del conn
+        pool.connection().close()
+        self.assertEqual(len(raws), 1)
+
+
+class TidyTests(unittest.TestCase):
+    def test_uncommitted_work_is_rolled_back_like_a_real_close(self):
+        pool, raws = _pool()
+        conn = pool.connection()
+        conn.cursor().execute("UPDATE qa_adjudications SET use_count = use_count + 1")
+        conn.close()
+        self.assertEqual(raws[0].rollbacks, 1)
+        self.assertEqual(raws[0].info.transaction_status, IDLE)
+
+    def test_with_block_commits_and_keeps_the_connection(self):
+        pool, raws = _pool()
+        conn = pool.connection()
+        with conn:
+            conn.cursor().execute("INSERT INTO ai_review_cache VALUES (1)")
+        self.assertEqual(raws[0].info.transaction_status, IDLE)
+        conn.close()
+        self.assertEqual(raws[0].rollbacks, 0)
+        self.assertEqual(pool.stats()["idle"], 1)
+
+    def test_session_mode_changed_by_the_caller_is_restored(self):
+        pool, raws = _pool()
+        conn = pool.connection()
+        conn.autocommit = True
+        conn.close()
+        self.assertFalse(raws[0].autocommit)
+
+    def test_broken_connection_is_not_returned(self):
+        pool, raws = _pool()
+        conn = pool.connection()
+        raws[0].broken = True
+        with self.assertRaises(psycopg2.OperationalError):
+            conn.cursor().execute("SELECT 1")
+        conn.close()
+        pool.connection().close()
+        self.assertEqual(len(raws), 2)
+        self.assertEqual(pool.stats()["discarded"], 1)
+
+
+class HealthTests(unittest.TestCase):
+    def test_idle_connection_is_pinged_and_replaced_when_dead(self):
+        clock = _Clock()
+        pool, raws = _pool(clock=clock, ping_after_seconds=30)
+        pool.connection().close()
+        clock.now += 10
+        pool.connection().close()
+        self.assertEqual(raws[0].executed, [])  # недавно вернувшееся — без проверки
+        clock.now += 60
+        raws[0].broken = True
+        pool.connection().close()
+        self.assertEqual(len(raws), 2)
+
+    def test_old_connection_is_recycled(self):
+        clock = _Clock()
+        pool, raws = _pool(clock=clock, max_lifetime_seconds=100)
+        pool.connection().close()
+        clock.now += 150
+        pool.connection().close()
+        self.assertEqual(len(raws), 2)
+        self.assertEqual(raws[0].closed, 1)
+
+
+class LimitTests(unittest.TestCase):
+    def test_pool_is_bounded(self):
+        pool, raws = _pool(max_size=2, acquire_timeout_seconds=0.05)
+        held = [pool.connection(), pool.connection()]
+        with self.assertRaises(TimeoutError):
+            pool.connection()
+        self.assertEqual(pool.stats()["timeouts"], 1)
+        held[0].close()
+        pool.connection().close()
+        self.assertEqual(len(raws), 2)
+
+    def test_waiter_gets_the_returned_connection(self):
+        pool, raws = _pool(max_size=1, acquire_timeout_seconds=5)
+        conn = pool.connection()
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(pool.connection()))
+        waiter.start()
+        conn.close()
+        waiter.join(5)
+        self.assertEqual(len(got), 1)
+        self.assertEqual(len(raws), 1)
+        got[0].close()
+
+
+class ConfigTests(unittest.TestCase):
+    def test_lock_connection_bypasses_the_pool(self):
+        import inspect
+
+        from call_qa.evaluation import runtime_store
+
+        source = inspect.getsource(runtime_store.distributed_call_lock)
+        self.assertIn("config.connect_rw(pooled=False)", source)
+
+    def test_no_per_call_encoding_statements_left(self):
+        import pathlib
+
+        root = pathlib.Path(config.__file__).parent
+        offenders = [str(path) for path in root.rglob("*.py")
+                     if "SET client_encoding" in path.read_text(encoding="utf-8")]
+        self.assertEqual(offenders, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
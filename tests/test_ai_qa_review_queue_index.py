@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Очередь ревью по индексу: приоритет считается при записи меты, очередь —
+один проход по idx_ai_eval_review_queue с keyset-пагинацией, stale — только для
+строк страницы. Соединения поддельные, Postgres не нужен."""
+from datetime import datetime, timezone
+from pathlib import Path
+import unittest
+from unittest import mock
+
+from call_qa import api as call_qa_api
+from call_qa import config
+from call_qa.review import queue as review_queue
+
+ROOT = Path(__file__).resolve().parents[1]
+T0 = datetime(2026, 10, 1, 9, 30, tzinfo=timezone.utc)
+
+
+class _Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        self.conn.executed.append((" ".join(sql.split()), params))
+
+    def fetchall(self):
+        return self.conn.rows.pop(0) if self.conn.rows else []
+
+    def fetchone(self):
+        return (len(self.conn.rows),)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Conn:
+    def __init__(self, rows=None):
+        self.rows = list(rows or [])
+        self.executed = []
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _row(call_id, priority=0, queued_at=T0, reasons=("critical",), kind="call"):
+    return (call_id, "ОП", "Оператор", "01.10 14:30", 80, list(reasons), priority, queued_at,
+            74, "fp", "th", kind, {"unchecked_weight": 5}, 90)
+
+
+class PriorityTests(unittest.TestCase):
+    def test_priority_is_position_of_most_severe_reason(self):
+        self.assertEqual(review_queue.review_priority(["critical", "asr"]), 0)
+        self.assertEqual(review_queue.review_priority(["asr"]), 3)
+        self.assertEqual(review_queue.review_priority([]), len(review_queue.REASON_PRIORITY))
+
+    def test_schema_backfill_case_matches_reason_order(self):
+        schema = (ROOT / "call_qa" / "rag" / "schema.sql").read_text(encoding="utf-8-sig")
+        for position, reason in enumerate(review_queue.REASON_PRIORITY):
+            self.assertIn(f"WHEN '{reason}' THEN {position}", schema)
+        self.assertIn("idx_ai_eval_review_queue", schema)
+        self.assertIn("WHERE review_outcome IS NULL", schema)
+
+
+class CursorTests(unittest.TestCase):
+    def test_round_trip(self):
+        cursor = call_qa_api.queue_cursor(1, T0, "wz_episode", 42)
+        self.assertEqual(call_qa_api.parse_queue_cursor(cursor), (1, T0, "wz_episode", 42))
+
+    def test_damaged_cursor_is_rejected(self):
+        with self.assertRaises(ValueError):
+            call_qa_api.parse_queue_cursor("1|вчера|call|42")
+        with self.assertRaises(ValueError):
+            call_qa_api.parse_queue_cursor("abc")
+
+
+class QueueListTests(unittest.TestCase):
+    def _list(self, conn, **kwargs):
+        flagged = []
+
+        def _flag(items):
+            flagged.extend(i["id"] for i in items)
+            for i in items:
+                i["stale"] = False
+
+        with mock.patch.object(config, "connect_ro", return_value=conn), \
+             mock.patch.object(call_qa_api, "_flag_stale_evaluations", side_effect=_flag):
+            return call_qa_api.review_queue_list(**kwargs), flagged
+
+    def test_page_comes_in_index_order_without_python_sort(self):
+        conn = _Conn([[_row(1, 0), _row(2, 3, reasons=("asr",))]])
+        items, flagged = self._list(conn, limit=2)
+        sql, params = conn.executed[0]
+        self.assertIn("FROM ai_evaluation_meta m", sql)
+        self.assertIn("ORDER BY m.review_priority, m.queued_at DESC, m.subject_kind, m.call_id", sql)
+        self.assertEqual(params[-2:], (2, 0))
+        self.assertEqual([i["id"] for i in items], [1, 2])
+        self.assertEqual(flagged, [1, 2])  # stale — только для строк страницы
+        self.assertEqual(items[1]["reasons"], ["asr"])
+        self.assertEqual(items[0]["unchecked_weight"], 5)
+        self.assertNotIn("_run_fp", items[0])
+
+    def test_after_cursor_continues_from_last_item(self):
+        conn = _Conn([[_row(7, 1)]])
+        after = call_qa_api.queue_cursor(1, T0, "call", 5)
+        self._list(conn, limit=30, offset=60, after=after)
+        sql, params = conn.executed[0]
+        self.assertIn("m.queued_at < %s", sql)
+        self.assertEqual(params[1:7], (1, 1, T0, T0, "call", 5))
+        self.assertEqual(params[-1], 0)  # курсор заменяет смещение
+
+    def test_item_cursor_points_at_its_own_position(self):
+        conn = _Conn([[_row(9, 2, reasons=("pending",), kind="wz_episode")]])
+        items, _ = self._list(conn)
+        self.assertEqual(call_qa_api.parse_queue_cursor(items[0]["cursor"]),
+                         (2, T0, "wz_episode", 9))
+
+    def test_bad_cursor_fails_before_touching_the_database(self):
+        with mock.patch.object(config, "connect_ro") as connect:
+            with self.assertRaises(ValueError):
+                call_qa_api.review_queue_list(after="garbage")
+        connect.assert_not_called()
+
+
+class WriteTimeTests(unittest.TestCase):
+    def test_meta_upsert_stores_priority_and_latest_run_identity(self):
+        conn = _Conn()
+        payload = {"direction_id": 74, "asr_mean_conf": 0.9,
+                   "criteria": [{"idx": 0, "source": "transcript", "ai": "Correct", "conf": 0.5}]}
+        with mock.patch.object(config, "connect_rw", return_value=conn), \
+             mock.patch.object(call_qa_api.trust_rollups, "refresh_subject_safe"):
+            call_qa_api._meta_upsert(5, "m", payload)
+        upsert, run = conn.executed
+        self.assertIn("review_priority=EXCLUDED.review_priority, queued_at=now()", upsert[0])
+        self.assertEqual(upsert[1][-1], 1)  # lowconf
+        self.assertIn("SET (run_fingerprint, run_transcript_hash)", run[0])
+
+    def test_backfill_computes_reasons_from_cached_card(self):
+        payload = {"direction_id": 74, "asr_mean_conf": 0.3, "criteria": []}
+        conn = _Conn([[("call", 5, "m", payload, T0)]])
+        self.assertEqual(review_queue.backfill_queue_index(conn, batch=10), 1)
+        insert_params = conn.executed[1][1]
+        self.assertEqual(insert_params[-2:], (3, T0))  # asr, время карточки
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Асинхронный клиент Soniox (call_qa/asr/soniox_async.py): запись течёт из GCS в
+multipart-загрузку без диска, опрос с нарастающей паузой, общий потолок
+распознаваний у вендора, уборка за собой при ошибке. Сеть — httpx.MockTransport."""
+import asyncio
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+import httpx
+
+from call_qa import batch_eval
+from call_qa import config
+from call_qa.asr import soniox
+from call_qa.asr import soniox_async
+
+AUDIO = b"ID3" + bytes(range(256)) * 40
+
+
+class _FakeVendor:
+    """GCS + Soniox в одном обработчике. polls — сколько раз статус «queued»."""
+
+    def __init__(self, polls=2, fail=False):
+        self.polls, self.fail = polls, fail
+        self.uploads, self.deleted, self.status_calls = [], [], {}
+        self.live, self.peak, self.next_id = 0, 0, 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        path, method = request.url.path, request.method
+        if request.url.host == "storage.googleapis.com":
+            assert request.headers["authorization"] == "Bearer gcs-token"
+            return httpx.Response(200, content=AUDIO)
+        if method == "POST" and path == "/v1/files":
+            self.uploads.append((request.headers["content-type"], request.content))
+            self.next_id += 1
+            return httpx.Response(200, json={"id": f"f{self.next_id}", "size": len(AUDIO),
+                                             "filename": "call.mp3"})
+        if method == "POST" and path == "/v1/transcriptions":
+            body = json.loads(request.content)
+            self.live += 1
+            self.peak = max(self.peak, self.live)
+            return httpx.Response(200, json={"id": "t" + body["file_id"][1:]})
+        if method == "GET" and path.endswith("/transcript"):
+            return httpx.Response(200, json={"text": "Сәлем", "tokens": [
+                {"text": "Сәлем", "speaker": "1", "confidence": 0.9, "start_ms": 0, "end_ms": 400}]})
+        if method == "GET" and path.startswith("/v1/transcriptions/"):
+            tid = path.rsplit("/", 1)[-1]
+            seen = self.status_calls[tid] = self.status_calls.get(tid, 0) + 1
+            if self.fail:
+                return httpx.Response(200, json={"status": "error", "error_message": "bad audio"})
+            if seen == 1:
+                return httpx.Response(503)
+            status = "completed" if seen > self.polls else "queued"
+            return httpx.Response(200, json={"status": status, "audio_duration_ms": 61000})
+        if method == "DELETE":
+            self.deleted.append(path)
+            if path.startswith("/v1/transcriptions/"):
+                self.live -= 1
+            return httpx.Response(204)
+        return httpx.Response(404)
+
+
+async def _token():
+    return "gcs-token"
+
+
+def _run(vendor, coro_factory, **engine_kwargs):
+    sleeps = []
+
+    async def _sleep(delay):
+        sleeps.append(delay)
+        await asyncio.sleep(0)
+
+    async def main():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(vendor))
+        engine = soniox_async.SonioxEngine(client=client, token_provider=_token,
+                                           poll_initial_s=1, poll_max_s=2, **engine_kwargs)
+        try:
+            return await coro_factory(engine), engine
+        finally:
+            await client.aclose()
+
+    with mock.patch.object(soniox_async, "_sleep", _sleep), \
+         mock.patch.object(config, "env", return_value="key"):
+        result, engine = asyncio.run(main())
+    return result, engine, sleeps
+
+
+class EngineTests(unittest.TestCase):
+    def test_gcs_audio_is_streamed_into_multipart_upload(self):
+        vendor = _FakeVendor()
+        got, _, _ = _run(vendor, lambda e: e.transcribe_gcs("bucket/2026/10/call.mp3"))
+        content_type, body = vendor.uploads[0]
+        boundary = content_type.split("boundary=", 1)[1]
+        self.assertTrue(body.startswith(f"--{boundary}\r\n".encode()))
+        self.assertIn(b'filename="call.mp3"', body)
+        self.assertIn(AUDIO, body)
+        self.assertTrue(body.endswith(f"\r\n--{boundary}--\r\n".encode()))
+        self.assertEqual(got["tokens"][0]["end_time_ms"], 400)
+        self.assertEqual(got["meta"]["audio_duration_ms"], 61000)
+        self.assertEqual(got["meta"]["file_size_bytes"], len(AUDIO))
+        self.assertEqual(soniox.assemble(got["tokens"], got["meta"])["text"], "[S1] Сәлем")
+        self.assertEqual(sorted(vendor.deleted), ["/v1/files/f1", "/v1/transcriptions/t1"])
+
+    def test_poll_backs_off_up_to_the_ceiling_and_survives_5xx(self):
+        vendor = _FakeVendor(polls=4)
+        _, _, sleeps = _run(vendor, lambda e: e.transcribe_gcs("b/call.mp3"))
+        self.assertEqual(len(sleeps), 4)  # 503 + три «queued»
+        self.assertLess(sleeps[0], sleeps[1])
+        self.assertTrue(all(0.9 <= s <= 2.2 for s in sleeps))
+
+    def test_vendor_cap_bounds_transcriptions_in_flight(self):
+        vendor = _FakeVendor(polls=3)
+
+        async def many(engine):
+            return await asyncio.gather(*(engine.transcribe_gcs(f"b/{i}.mp3") for i in range(25)))
+
+        got, engine, _ = _run(vendor, many, max_in_flight=4)
+        self.assertEqual(len(got), 25)
+        self.assertEqual(vendor.peak, 4)
+        self.assertEqual(engine.peak_in_flight, 4)
+        self.assertEqual(vendor.live, 0)
+
+    def test_vendor_error_still_deletes_file_and_transcription(self):
+        vendor = _FakeVendor(fail=True)
+        with self.assertRaisesRegex(RuntimeError, "bad audio"):
+            _run(vendor, lambda e: e.transcribe_gcs("b/call.mp3"))
+        self.assertEqual(sorted(vendor.deleted), ["/v1/files/f1", "/v1/transcriptions/t1"])
+
+
+class _StubEngine:
+    created = []
+
+    def __init__(self, max_in_flight=None):
+        self.in_flight, self.peak_in_flight, self.paths = 0, 1, []
+        _StubEngine.created.append(max_in_flight)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def transcribe_gcs(self, audio_path):
+        self.paths.append(audio_path)
+        return {"tokens": [{"text": "Алло", "speaker": "1", "confidence": 0.8,
+                            "start_time_ms": 0, "end_time_ms": 900}],
+                "meta": {"audio_duration_ms": 1000}}
+
+
+class AsrStageTests(unittest.TestCase):
+    def test_stage_recognizes_through_engine_and_checkpoints(self):
+        calls = [{"id": 1, "audio_path": "b/1.mp3"}, {"id": 2, "audio_path": "b/2.mp3"}]
+        with tempfile.TemporaryDirectory() as workdir, \
+             mock.patch.object(soniox_async, "SonioxEngine", _StubEngine), \
+             mock.patch.object(batch_eval, "_audio_object_fingerprint", return_value="afp"), \
+             mock.patch.object(batch_eval.runtime_store, "asr_config", return_value={"m": 1}), \
+             mock.patch.object(batch_eval.runtime_store, "get_transcript",
+                               side_effect=lambda **kw: None if kw["call_id"] == 1 else {
+                                   "id": 7, "text": "[S1] кэш", "transcript_hash": "h"}), \
+             mock.patch.object(batch_eval.runtime_store, "put_transcript", return_value=11) as put, \
+             mock.patch.object(batch_eval, "log"):
+            done = batch_eval.asr_stage(calls, workdir, workers=2, in_flight=8)
+            with open(f"{workdir}/transcripts.jsonl", encoding="utf-8") as f:
+                lines = [json.loads(line) for line in f]
+        self.assertEqual(_StubEngine.created[-1], 8)
+        self.assertEqual(done["call:1"]["transcript_cache_id"], 11)
+        self.assertEqual(done["call:1"]["asm"]["text"], "[S1] Алло")
+        self.assertEqual(done["call:2"]["transcript_cache_id"], 7)
+        self.assertEqual(put.call_count, 1)  # из кэша БД повторно не пишем
+        self.assertEqual(sorted(r["call_id"] for r in lines), [1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Сводки метрик доверия (call_qa/review/rollups.py): дельты вкладов субъектов,
+сложенные в сводку, дают те же метрики, что полный пересчёт api._verdict_metrics /
+api._reviewed_metrics — в том числе после переоценок и исправлений."""
+from datetime import date
+import random
+import unittest
+
+from call_qa import api
+from call_qa.review import rollups
+
+_AI = ("Correct", "Incorrect", "Deficiency", "N/A", "Pending")
+_HUMAN = ("Correct", "Error", "Incorrect", "Недочёт", "N/A", None, "мусор")
+_DIRECTIONS = {74: "Поток", 75: "Основа"}
+
+
+def _card(rng, criteria_count):
+    return [{"idx": i, "name": f"Критерий {i}", "ai": rng.choice(_AI),
+             "source": rng.choice(("transcript", "transcript", "system_api"))}
+            for i in range(criteria_count)]
+
+
+def _raw_row(rng, subject, model):
+    kind, call_id = subject
+    direction_id = 74 if call_id % 2 else 75
+    count = rng.randint(1, 5)
+    return (kind, call_id, model, date(2026, 10, rng.randint(1, 9)), direction_id,
+            _card(rng, count), [rng.choice(_HUMAN) for _ in range(count - rng.randint(0, 1))],
+            _DIRECTIONS[direction_id])
+
+
+def _fold(store, cells, key_len):
+    for key, values in rollups.deltas([], cells, key_len).items():
+        acc = store.setdefault(key, [0] * len(values))
+        for i, value in enumerate(values):
+            acc[i] += value
+
+
+def _apply(store, old, new, key_len):
+    for key, values in rollups.deltas(old, new, key_len).items():
+        acc = store.setdefault(key, [0] * len(values))
+        for i, value in enumerate(values):
+            acc[i] += value
+
+
+class _ReviewedCursor:
+    def __init__(self, meta_rows, correction_rows):
+        self.meta_rows, self.correction_rows, self.current = meta_rows, correction_rows, []
+
+    def execute(self, sql, _params=None):
+        self.current = (self.meta_rows if "FROM ai_evaluation_meta" in sql
+                        else self.correction_rows)
+
+    def fetchall(self):
+        return list(self.current)
+
+
+class VerdictParityTests(unittest.TestCase):
+    def test_rollups_match_full_computation_after_reevaluations(self):
+        rng = random.Random(7)
+        subjects = [("call", i) for i in range(1, 40)] + [("wz_episode", i) for i in range(1, 15)]
+        latest, facts, store = {}, {}, {}
+        for _ in range(200):  # оценки и переоценки вперемешку, иногда со сменой модели
+            subject = rng.choice(subjects)
+            row = _raw_row(rng, subject, rng.choice(("m-1", "m-2")))
+            latest[subject] = row
+            cells = rollups.verdict_cells(row)
+            _apply(store, facts.get(subject), cells, len(rollups._VERDICT_KEY))
+            facts[subject] = cells
+
+        full = api._verdict_metrics(row[5:8] for row in latest.values())
+        rolled = api._verdict_metrics_from_cells(
+            (key[2], key[3], key[6], key[7], values[0]) for key, values in store.items())
+        for key in ("total", "agreement", "alarm_precision", "recall",
+                    "correct_reliability", "matrix"):
+            self.assertEqual(full[key], rolled[key], key)
+        order = lambda rows: sorted(rows, key=lambda r: (r["direction"], r["name"]))  # noqa: E731
+        self.assertEqual(order(full["by_criterion"]), order(rolled["by_criterion"]))
+
+    def test_reevaluation_replaces_previous_contribution(self):
+        crit = [{"idx": 0, "name": "Приветствие", "ai": "Incorrect", "source": "transcript"}]
+        first = ("call", 1, "m", date(2026, 10, 1), 74, crit, ["Correct"], "Поток")
+        again = ("call", 1, "m", date(2026, 10, 2), 74,
+                 [dict(crit[0], ai="Correct")], ["Correct"], "Поток")
+        store = {}
+        _fold(store, rollups.verdict_cells(first), len(rollups._VERDICT_KEY))
+        _apply(store, rollups.verdict_cells(first), rollups.verdict_cells(again),
+               len(rollups._VERDICT_KEY))
+        live = {key: v for key, v in store.items() if any(v)}
+        self.assertEqual(list(live), [("2026-10-02", 74, "Поток", "Приветствие", "m", "call",
+                                       "Correct", "Correct")])
+
+    def test_scope_uses_subject_direction(self):
+        row = ("call", 3, "m", date(2026, 10, 1), 75,
+               [{"idx": 0, "name": "К", "ai": "Correct", "source": "transcript"}],
+               ["Correct"], "Основа")
+        self.assertEqual(rollups.verdict_cells(row)[0][1], 75)
+
+
+class ReviewParityTests(unittest.TestCase):
+    def test_rollups_match_full_reviewed_metrics(self):
+        rng = random.Random(11)
+        meta, corrections = [], []
+        for call_id in range(1, 60):
+            kind = "call" if call_id % 3 else "wz_episode"
+            crits = _card(rng, rng.randint(1, 4))
+            meta.append((call_id, rng.choice(("confirmed", "adjudicated")), crits, kind))
+            for c in crits:
+                if rng.random() < 0.3:
+                    corrections.append((kind, call_id, c["idx"], rng.choice(_AI[:4])))
+        full = api._reviewed_metrics(_ReviewedCursor(meta, corrections))
+
+        corr = {(k, cid, idx): v for k, cid, idx, v in corrections}
+        store = {}
+        for call_id, outcome, crits, kind in meta:
+            row = (call_id, outcome, crits, kind, "m", date(2026, 10, 3), 74)
+            _fold(store, rollups.review_cells(row, corr), len(rollups._REVIEW_KEY))
+        totals = [sum(values[i] for values in store.values())
+                  for i in range(len(api._REVIEW_COUNTERS))]
+        rolled = api._reviewed_from_counters(dict(zip(api._REVIEW_COUNTERS, totals)))
+        self.assertEqual(full, rolled)
+
+
+class _DashboardCursor:
+    def __init__(self, built, cells, review):
+        self.built, self.cells, self.review = built, cells, review
+        self.queries, self.last = [], None
+
+    def execute(self, sql, params=None):
+        self.queries.append((" ".join(sql.split()), params))
+        self.last = sql
+
+    def fetchone(self):
+        if "qa_trust_rollup_state" in self.last:
+            return ("2026-10-17",) if self.built else None
+        return self.review
+
+    def fetchall(self):
+        return self.cells
+
+
+class DashboardTests(unittest.TestCase):
+    def test_not_built_means_full_computation(self):
+        self.assertIsNone(rollups.dashboard(_DashboardCursor(False, [], None)))
+
+    def test_scope_filters_verdict_rollups_by_direction(self):
+        cur = _DashboardCursor(True, [("Поток", "К", "Incorrect", "Incorrect", 3),
+                                      ("Поток", "К", "Correct", "Incorrect", 1)],
+                               (2, 1, 5, 1, 2, 1))
+        verdict, reviewed = rollups.dashboard(cur, scope_family=[74, 740], model="m")
+        self.assertEqual(verdict["alarm_precision"], {"pct": 75, "hits": 3, "total": 4})
+        self.assertEqual(reviewed["confirmed"], 2)
+        self.assertEqual(reviewed["alarm_precision"], {"pct": 50, "hits": 1, "total": 2})
+        verdict_sql, params = cur.queries[1]
+        self.assertIn("WHERE direction_id = ANY(%s)", verdict_sql)
+        self.assertEqual(params, ([74, 740],))
+
+
+if __name__ == "__main__":
+    unittest.main()
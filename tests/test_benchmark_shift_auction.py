@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Нагрузочный прогон аукциона (scripts/benchmark_shift_auction.py): арифметика отчёта.
+
+Сеть и база не нужны: проверяем разбор Server-Timing, план проигрывания журнала
+и учёт задержки доставки, когда событие обгоняет ответ на захват.
+"""
+
+import os
+import sys
+import unittest
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT / "scripts") not in sys.path:
+    sys.path.insert(0, str(ROOT / "scripts"))
+
+import benchmark_shift_auction as bench  # noqa: E402
+
+
+class ReportMathTests(unittest.TestCase):
+    def test_percentiles_use_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, bench.percentile(values, 50))
+        self.assertEqual(99, bench.percentile(values, 99))
+        self.assertIsNone(bench.percentile([], 95))
+        self.assertEqual(0, bench.summarize([])["count"])
+
+    def test_server_timing_sums_repeated_metrics(self):
+        header = "auth-access;dur=0.8, auction-lock;dur=1.5, auction-lock;dur=0.5, db"
+        timings = bench.parse_server_timing(header)
+        self.assertEqual(2.0, timings["auction-lock"])
+        self.assertNotIn("db", timings)
+
+    def test_event_ahead_of_claim_response_counts_as_zero_lag(self):
+        recorder = bench.Recorder()
+        recorder.event_seen("lot_claimed", 7, 10.0)
+        recorder.lot_changed("lot_claimed", 7, 10.5)
+        recorder.event_seen("lot_claimed", 7, 10.75)
+        recorder.event_seen("lot_released", 7, 11.0)
+        self.assertEqual([0.0, 250.0], recorder.delivery_lag)
+
+
+class ReplayPlanTests(unittest.TestCase):
+    def test_journal_is_replayed_oldest_first_with_scaled_pauses(self):
+        entries = [
+            {"claimed_at": "2026-10-10T10:00:04", "claimed_by": 2, "shift_date": "2026-10-12",
+             "start_time": "09:00", "end_time": "18:00", "is_post_auction": False},
+            {"claimed_at": "2026-10-10T10:00:03", "claimed_by": 3, "shift_date": "2026-10-12",
+             "start_time": "08:00", "end_time": "12:00", "is_post_auction": True},
+            {"claimed_at": "2026-10-10T10:00:00", "claimed_by": 1, "shift_date": "2026-10-12",
+             "start_time": "07:00", "end_time": "16:00", "is_post_auction": False},
+        ]
+        plan, skipped = bench.replay_plan(entries, speed=2)
+        self.assertEqual(1, skipped)
+        self.assertEqual([(0.0, 1), (2.0, 2)], [(row[0], row[1]) for row in plan])
+        self.assertEqual(("2026-10-12", "09:00", "18:00"), plan[1][2:])
+
+
+class LocalDatabaseGuardTests(unittest.TestCase):
+    def test_only_this_machine_counts_as_local(self):
+        for host in (None, "", "localhost", "127.0.0.1", "127.0.1.1", "::1", "[::1]", "/var/run/postgresql"):
+            self.assertTrue(bench.is_local_db_host(host), host)
+        for host in ("10.0.0.5", "db.example.com", "/cloudsql/project:region:instance"):
+            self.assertFalse(bench.is_local_db_host(host), host)
+
+    def test_remote_host_is_refused_before_connecting(self):
+        with mock.patch.dict(os.environ, {"POSTGRES_HOST": "10.0.0.5"}):
+            with self.assertRaisesRegex(SystemExit, "--allow-remote-db"):
+                bench._database()
+        self.assertTrue(bench._parse_args(["--admin-id", "1", "--allow-remote-db"]).allow_remote_db)
+        self.assertFalse(bench._parse_args(["--admin-id", "1"]).allow_remote_db)
+
+
+if __name__ == "__main__":
+    unittest.main()
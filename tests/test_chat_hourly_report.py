@@ -81,7 +81,7 @@ def _namespace(fake_requests=None):
         'os': os, 're': re, 'io': io, 'time': time, 'logging': logging,
         'threading': threading, 'datetime': datetime, 'timedelta': timedelta,
         'ZoneInfo': ZoneInfo,
-        'requests': fake_requests,
+        '_chat2desk_session': fake_requests,
         '_chat2desk_authorization_header': lambda: 'token',
         '_chat2desk_api_base_url': lambda: 'https://chat2desk.test',
         '_chat2desk_api_error_message': lambda response, report, day: 'ошибка Chat2Desk',
@@ -0,0 +1,278 @@
+"""Фоновые выгрузки (export_jobs.py): очередь, чекпоинты по суткам, повтор с чекпоинта.
+
+Воркер гоняется на записывающей фейковой базе — очередь в PostgreSQL здесь не
+поднять, а логика «досчитать только недостающие сутки» живёт в самом воркере.
+SQL очереди проверяется методами Database, извлечёнными из database.py через AST.
+"""
+
+import ast
+import contextlib
+import json
+import logging
+import sys
+import unittest
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from tests import source_cache
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import export_jobs  # noqa: E402
+
+DATABASE_PATH = ROOT / "database.py"
+BOT_PATH = ROOT / "bot_schedule2.py"
+
+
+class _JobsDb:
+    def __init__(self, job, chunks=None):
+        self.job = job
+        self.chunks = dict(chunks or {})
+        self.saved = []
+        self.finished = None
+        self.failed = None
+
+    def claim_export_job(self, worker, stale_seconds, max_attempts):
+        job, self.job = self.job, None
+        return job
+
+    def get_export_job_chunks(self, job_id):
+        return dict(self.chunks)
+
+    def save_export_job_chunk(self, job_id, unit, payload, done, total):
+        self.chunks[unit] = payload
+        self.saved.append((unit, done, total))
+
+    def touch_export_job(self, job_id):
+        pass
+
+    def finish_export_job(self, job_id, file_name, bucket, blob_path, size):
+        self.finished = (file_name, bucket, blob_path, size)
+
+    def fail_export_job(self, job_id, error, retry=False, retry_delay_seconds=0):
+        self.failed = (error, retry)
+        self.retry_delay = retry_delay_seconds
+
+
+class WorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        self.uploads = []
+
+        def run_unit(params, unit, context):
+            self.calls.append(unit)
+            if unit == params.get('broken'):
+                raise RuntimeError('источник не ответил')
+            return {'day': unit, 'rows': context['rows']}
+
+        def build(params, chunks, output, context):
+            output.write(json.dumps(chunks).encode('utf-8'))
+            return 'export.json'
+
+        export_jobs.register(export_jobs.ExportKind(
+            'test_days',
+            plan=lambda params: params['days'],
+            prepare=lambda params: {'rows': 3},
+            run_unit=run_unit,
+            build=build,
+            content_type='application/json',
+        ))
+
+    def _upload(self, job, file_name, fileobj, content_type):
+        self.uploads.append((file_name, json.loads(fileobj.read().decode('utf-8')), content_type))
+        return 'bucket', f"exports/{job['id']}/{file_name}"
+
+    def _workers(self, db):
+        return export_jobs.ExportJobWorkers(db, self._upload, max_attempts=3)
+
+    def test_resumes_from_checkpoint_and_keeps_plan_order(self):
+        days = ['2026-09-01', '2026-09-02', '2026-09-03']
+        db = _JobsDb(
+            {'id': 7, 'kind': 'test_days', 'params': {'days': days}, 'attempts': 2},
+            chunks={'2026-09-02': {'day': '2026-09-02', 'rows': 'из чекпоинта'}},
+        )
+        self.assertTrue(self._workers(db).run_once('w-0'))
+
+        self.assertEqual(['2026-09-01', '2026-09-03'], self.calls)
+        self.assertEqual([('2026-09-01', 2, 3), ('2026-09-03', 3, 3)], db.saved)
+        (file_name, chunks, content_type), = self.uploads
+        self.assertEqual([c['day'] for c in chunks], days)
+        self.assertEqual('из чекпоинта', chunks[1]['rows'])
+        self.assertEqual(('export.json', 'bucket', 'exports/7/export.json'), db.finished[:3])
+        self.assertIsNone(db.failed)
+
+    def test_failed_unit_requeues_until_attempts_run_out(self):
+        params = {'days': ['2026-09-01', '2026-09-02'], 'broken': '2026-09-02'}
+        db = _JobsDb({'id': 8, 'kind': 'test_days', 'params': params, 'attempts': 1})
+        with self.assertLogs(level='ERROR'):
+            self._workers(db).run_once('w-0')
+        # Первые сутки уже в чекпоинте: повтор начнёт со вторых.
+        self.assertEqual(['2026-09-01'], list(db.chunks))
+        self.assertEqual(('источник не ответил', True), db.failed)
+        self.assertEqual(30.0, db.retry_delay)
+        self.assertIsNone(db.finished)
+
+        db = _JobsDb({'id': 8, 'kind': 'test_days', 'params': params, 'attempts': 3})
+        with self.assertLogs(level='ERROR'):
+            self._workers(db).run_once('w-0')
+        self.assertFalse(db.failed[1])
+
+    def test_retry_waits_longer_after_each_attempt_and_does_not_wake_workers(self):
+        params = {'days': ['2026-09-01'], 'broken': '2026-09-01'}
+        workers = export_jobs.ExportJobWorkers(
+            None, self._upload, max_attempts=10, retry_seconds=30, retry_max_seconds=300)
+        self.assertEqual([30, 60, 120, 240, 300, 300], [workers.retry_delay(n) for n in range(1, 7)])
+
+        workers.db = _JobsDb({'id': 11, 'kind': 'test_days', 'params': params, 'attempts': 2})
+        with self.assertLogs(level='ERROR'):
+            workers.run_once('w-0')
+        self.assertEqual(('источник не ответил', True), workers.db.failed)
+        self.assertEqual(60, workers.db.retry_delay)
+        # Повтор ждёт своего retry_at в базе, а не будит воркеров сразу.
+        self.assertFalse(workers._wake.is_set())
+
+    def test_parallel_units_checkpoint_every_success_before_the_failure_surfaces(self):
+        kind = export_jobs.get_kind('test_days')
+        export_jobs.register(export_jobs.ExportKind(
+            'test_days_parallel', plan=kind.plan, prepare=kind.prepare,
+            run_unit=kind.run_unit, build=kind.build, unit_workers=3))
+        days = ['2026-09-01', '2026-09-02', '2026-09-03', '2026-09-04']
+        params = {'days': days, 'broken': '2026-09-01'}
+        db = _JobsDb({'id': 10, 'kind': 'test_days_parallel', 'params': params, 'attempts': 1})
+        with self.assertLogs(level='ERROR'):
+            self._workers(db).run_once('w-0')
+        # Упавшие первые сутки не заслоняют остальные: они уже в чекпоинте.
+        self.assertEqual(days[1:], sorted(db.chunks))
+        self.assertEqual(('источник не ответил', True), db.failed)
+
+    def test_unknown_kind_fails_instead_of_hanging(self):
+        db = _JobsDb({'id': 9, 'kind': 'нет_такого', 'params': {}, 'attempts': 1})
+        with self.assertLogs(level='ERROR'):
+            self._workers(db).run_once('w-0')
+        self.assertIn('неизвестный вид', db.failed[0])
+
+    def test_empty_queue(self):
+        self.assertFalse(self._workers(_JobsDb(None)).run_once('w-0'))
+
+    def test_progress_signal_wakes_waiters(self):
+        seen = export_jobs.current_signal()
+        export_jobs.notify()
+        self.assertGreater(export_jobs.wait_for_signal(seen, 0.1), seen)
+
+
+class _Cursor:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+
+def _database_class():
+    tree = source_cache.parse(source_cache.read(DATABASE_PATH))
+    constants = [
+        node for node in tree.body
+        if isinstance(node, ast.Assign)
+        and any(getattr(t, "id", None) == "EXPORT_JOB_COLUMNS_SQL" for t in node.targets)
+    ]
+    methods = [
+        source_cache.function_node(DATABASE_PATH, name, class_name="Database")
+        for name in ("_serialize_export_job", "create_export_job", "claim_export_job", "fail_export_job")
+    ]
+    cls = ast.ClassDef(name="Database", bases=[], keywords=[], body=methods, decorator_list=[])
+    module = ast.Module(body=constants + [cls], type_ignores=[])
+    namespace = {"json": json, "logging": logging, "Json": lambda value: ("json", value)}
+    exec(compile(ast.fix_missing_locations(module), str(DATABASE_PATH), "exec"), namespace)
+    return namespace["Database"]
+
+
+class _FakeDb(_database_class()):
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    @contextlib.contextmanager
+    def _get_cursor(self):
+        yield self.cursor
+
+
+def _row(job_id, status='queued'):
+    created = datetime(2026, 9, 1, 10, 0)
+    return (job_id, 'szov_chat', 5, '{"date_from": "2026-08-01"}', status, 0, 0, 0, None,
+            None, None, None, None, created, None, None)
+
+
+class QueueSqlTest(unittest.TestCase):
+    def test_claim_skips_locked_rows_and_closes_exhausted_ones(self):
+        cursor = _Cursor([_row(3, 'running')])
+        job = _FakeDb(cursor).claim_export_job('export-job-0', 600, 3)
+
+        self.assertEqual({'date_from': '2026-08-01'}, job['params'])
+        self.assertEqual('2026-09-01T10:00:00', job['created_at'])
+        (abandon_sql, abandon_params), (claim_sql, claim_params) = cursor.executed
+        self.assertIn("attempts >= %s", abandon_sql)
+        self.assertIn("DELETE FROM export_job_chunks", abandon_sql)
+        self.assertIn("FOR UPDATE SKIP LOCKED", claim_sql)
+        self.assertIn("attempts = j.attempts + 1", claim_sql)
+        self.assertIn("status = 'queued' AND (retry_at IS NULL OR retry_at <= NOW())", claim_sql)
+        self.assertEqual(('export-job-0', 600.0, 3), claim_params)
+
+    def test_second_click_gets_the_same_pending_job(self):
+        cursor = _Cursor([_row(4)])
+        job = _FakeDb(cursor).create_export_job('szov_chat', 5, {'date_from': '2026-08-01'})
+        self.assertEqual(4, job['id'])
+        self.assertEqual(1, len(cursor.executed))
+
+    def test_retry_keeps_checkpoints_final_failure_drops_them(self):
+        cursor = _Cursor()
+        _FakeDb(cursor).fail_export_job(4, 'Oktell не ответил', retry=True, retry_delay_seconds=60)
+        (sql, params), = cursor.executed
+        self.assertIn("status = 'queued'", sql)
+        self.assertIn("retry_at = NOW() + make_interval(secs => %s)", sql)
+        self.assertEqual(('Oktell не ответил', 60.0, 4), params)
+
+        cursor = _Cursor()
+        _FakeDb(cursor).fail_export_job(4, 'Oktell не ответил')
+        self.assertIn("DELETE FROM export_job_chunks", cursor.executed[-1][0])
+
+
+class SzovChatJobUnitTest(unittest.TestCase):
+    def test_failed_chat2desk_day_is_retried_not_checkpointed_as_error(self):
+        module = ast.Module(
+            body=[source_cache.function_node(BOT_PATH, "_szov_chat_export_job_unit")],
+            type_ignores=[])
+
+        def past_block(day_str, lookup):
+            raise RuntimeError('Chat2Desk 502')
+
+        def or_error(day_str, lookup):
+            raise AssertionError('строка с ошибкой ушла бы в чекпоинт')
+
+        from zoneinfo import ZoneInfo
+        namespace = {"datetime": datetime, "ZoneInfo": ZoneInfo,
+                     "CHAT_HOURLY_TIMEZONE": "Asia/Almaty",
+                     "_szov_chat_export_past_block": past_block,
+                     "_szov_chat_export_past_block_or_error": or_error}
+        exec(compile(module, str(BOT_PATH), "exec"), namespace)
+        with self.assertRaisesRegex(RuntimeError, 'Chat2Desk 502'):
+            namespace["_szov_chat_export_job_unit"]({}, '2020-01-01', {'lookup': {}})
+
+
+class OktellDetailJobPlanTest(unittest.TestCase):
+    def test_days_run_from_latest_like_the_synchronous_cursor(self):
+        names = ("_oktell_parse_date", "_oktell_billing_detail_job_range", "_oktell_billing_detail_job_plan")
+        module = ast.Module(
+            body=[source_cache.function_node(BOT_PATH, name) for name in names], type_ignores=[])
+        namespace = {"datetime": datetime, "timedelta": timedelta}
+        exec(compile(module, str(BOT_PATH), "exec"), namespace)
+
+        plan = namespace["_oktell_billing_detail_job_plan"]({'date_from': '2026-08-30', 'date_to': '2026-09-01'})
+        self.assertEqual(['2026-09-01', '2026-08-31', '2026-08-30'], plan)
+
+
+if __name__ == "__main__":
+    unittest.main()
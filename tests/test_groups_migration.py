@@ -195,6 +195,10 @@ def _membership_edit_database(cursor):
             (int(operator_id), month)
         )
     )
+    database.rollup_refreshes = []
+    database._refresh_operator_month_rollups_tx = (
+        lambda _cursor, **kwargs: database.rollup_refreshes.append(kwargs)
+    )
     return database
 
 
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""Общий HTTP-слой интеграций (http_clients.py): пул, темп, паузы по 429, повтор, метрики.
+
+Сеть заменена адаптером requests, отдающим заготовленные ответы; часы и сон
+темпа — поддельные, поэтому тесты не ждут настоящих секунд.
+"""
+
+import sys
+import unittest
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from http.client import RemoteDisconnected
+from pathlib import Path
+from unittest import mock
+
+import requests
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import http_clients  # noqa: E402
+import tez_binotel_calls  # noqa: E402
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(round(seconds, 3))
+        self.now += seconds
+
+
+class _FakeAdapter(requests.adapters.BaseAdapter):
+    """Отдаёт (status, headers, body) или бросает исключение — по порядку."""
+
+    def __init__(self, outcomes=()):
+        super().__init__()
+        self.outcomes = list(outcomes)
+        self.sent = []
+
+    def send(self, request, **kwargs):
+        self.sent.append((request.method, request.url))
+        outcome = self.outcomes.pop(0) if self.outcomes else (200, {}, '{}')
+        if isinstance(outcome, BaseException):
+            raise outcome
+        status, headers, body = outcome
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response._content = body.encode('utf-8')
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def _dropped_keepalive_error():
+    inner = RemoteDisconnected("Remote end closed connection without response")
+    return requests.exceptions.ConnectionError(
+        requests.packages.urllib3.exceptions.ProtocolError("Connection aborted.", inner))
+
+
+class _IntegrationCase(unittest.TestCase):
+    def setUp(self):
+        self.name = 'test:' + self.id()
+        self.clock = _Clock()
+
+    def session(self, outcomes=(), **options):
+        session = http_clients.session(self.name, **options)
+        shared = session._integration
+        shared.pacer = http_clients.Pacer(options.get('rate_per_second'), options.get('burst'),
+                                          clock=self.clock, sleep=self.clock.sleep)
+        adapter = _FakeAdapter(outcomes)
+        session.mount('https://', adapter)
+        return session, adapter
+
+    def stats(self):
+        return http_clients.snapshot()['integrations'][self.name]
+
+
+class PoolTests(_IntegrationCase):
+    def test_clients_of_one_integration_share_the_pool(self):
+        first = http_clients.session(self.name)
+        second = http_clients.session(self.name)
+        self.assertIsNot(first, second)
+        self.assertIs(first.get_adapter('https://a.test/'), second.get_adapter('https://b.test/'))
+        # Куки и заголовки у каждого клиента свои.
+        first.headers['Authorization'] = 'Bearer a'
+        self.assertNotIn('Authorization', second.headers)
+
+    def test_closing_a_client_keeps_the_neighbours_connections(self):
+        first = http_clients.session(self.name)
+        adapter = first.get_adapter('https://a.test/')
+        with mock.patch.object(adapter, 'close') as close:
+            first.close()
+        close.assert_not_called()
+        self.assertIs(adapter, http_clients.session(self.name).get_adapter('https://a.test/'))
+
+    def test_first_caller_sets_the_pool_size(self):
+        session = http_clients.session(self.name, pool_connections=1, pool_maxsize=4)
+        adapter = session.get_adapter('http://proxy.test/')
+        self.assertEqual((adapter._pool_connections, adapter._pool_maxsize), (1, 4))
+
+
+class RetryTests(_IntegrationCase):
+    def test_dropped_keepalive_is_retried_for_get(self):
+        session, adapter = self.session([_dropped_keepalive_error(), (200, {}, '{"ok":1}')])
+        self.assertEqual(session.get('https://api.test/x').json(), {'ok': 1})
+        self.assertEqual(len(adapter.sent), 2)
+        self.assertEqual(self.stats()['retries'], 1)
+        self.assertEqual(self.stats()['errors'], 1)
+
+    def test_post_is_never_repeated_by_the_layer(self):
+        session, adapter = self.session([_dropped_keepalive_error()])
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            session.post('https://api.test/x', json={})
+        self.assertEqual(len(adapter.sent), 1)
+
+    def test_timeout_is_not_retried(self):
+        session, adapter = self.session([requests.exceptions.ReadTimeout('read timeout=5')])
+        with self.assertRaises(requests.exceptions.ReadTimeout):
+            session.get('https://api.test/x')
+        self.assertEqual(len(adapter.sent), 1)
+
+    def test_retries_zero_leaves_repeating_to_the_client(self):
+        session, adapter = self.session([_dropped_keepalive_error()], retries=0)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            session.get('https://api.test/x')
+        self.assertEqual(len(adapter.sent), 1)
+
+    def test_dropped_connection_walks_the_cause_chain(self):
+        exc = requests.exceptions.ConnectionError("Connection aborted.")
+        exc.__context__ = BrokenPipeError(32, "Broken pipe")
+        self.assertTrue(http_clients.dropped_connection(exc))
+        self.assertFalse(http_clients.dropped_connection(
+            requests.exceptions.ConnectTimeout("timeout=60")))
+
+
+class ThrottleTests(_IntegrationCase):
+    def test_429_pauses_the_host_for_every_client(self):
+        session, _adapter = self.session([(429, {'Retry-After': '3'}, ''), (200, {}, '{}')])
+        self.assertEqual(session.get('https://api.test/x').status_code, 429)
+        # Другой клиент той же интеграции ждёт паузу, а не ловит второй отказ.
+        neighbour = http_clients.session(self.name)
+        neighbour.mount('https://', _adapter)
+        neighbour.get('https://api.test/y')
+        self.assertEqual(self.clock.slept, [3.0])
+        self.assertEqual(self.stats()['throttled'], 1)
+
+    def test_pause_is_per_host(self):
+        session, _adapter = self.session([(429, {'Retry-After': '3'}, ''), (200, {}, '{}')])
+        session.get('https://gemini.test/x')
+        session.get('https://openrouter.test/x')
+        self.assertEqual(self.clock.slept, [])
+
+    def test_pause_is_capped(self):
+        session, _adapter = self.session([(429, {'Retry-After': '3600'}, ''), (200, {}, '{}')])
+        session.get('https://api.test/x')
+        session.get('https://api.test/x')
+        self.assertEqual(self.clock.slept, [http_clients.MAX_PAUSE_SECONDS])
+
+    def test_retry_after_as_http_date(self):
+        now = datetime(2026, 10, 1, 12, 0, tzinfo=timezone.utc)
+        response = requests.Response()
+        response.headers['Retry-After'] = format_datetime(now + timedelta(seconds=7), usegmt=True)
+        self.assertEqual(http_clients.retry_after_seconds(response, now=now.timestamp()), 7.0)
+
+    def test_binotel_too_frequent_in_the_body_pauses_binotel(self):
+        body = '{"status":"error","message":"Requests are too frequent. You can do this request after 2 sec."}'
+        session, _adapter = self.session([(200, {}, body), (200, {}, '{"status":"success"}')],
+                                         throttled=tez_binotel_calls._too_frequent_response)
+        session.post('https://api.binotel.test/stats/x.json', json={})
+        session.post('https://api.binotel.test/stats/x.json', json={})
+        self.assertEqual(self.clock.slept, [2.4])
+
+    def test_quota_remaining_is_reported(self):
+        session, _adapter = self.session([(200, {'X-RateLimit-Remaining': '17'}, '{}')])
+        session.get('https://api.test/x')
+        self.assertEqual(self.stats()['quota_remaining'], 17)
+
+
+class PacerTests(unittest.TestCase):
+    def test_rate_spaces_requests_after_the_burst(self):
+        clock = _Clock()
+        pacer = http_clients.Pacer(50, burst=2, clock=clock, sleep=clock.sleep)
+        for _ in range(4):
+            pacer.acquire()
+        self.assertEqual(clock.slept, [0.02, 0.02])
+
+    def test_without_rate_only_pauses_wait(self):
+        clock = _Clock()
+        pacer = http_clients.Pacer(clock=clock, sleep=clock.sleep)
+        self.assertEqual(pacer.acquire('a'), 0.0)
+        pacer.pause(5, 'a')
+        self.assertEqual(pacer.acquire('b'), 0.0)
+        self.assertEqual(pacer.acquire('a'), 5.0)
+
+
+class MetricsTests(_IntegrationCase):
+    def test_snapshot_and_reset(self):
+        session, _adapter = self.session([(200, {}, '{}'), (502, {}, ''), (200, {}, '{}')])
+        for _ in range(3):
+            session.get('https://api.test/x')
+        stats = self.stats()
+        self.assertEqual(stats['requests'], 3)
+        self.assertEqual(stats['status'], {'2xx': 2, '5xx': 1})
+        self.assertIsNotNone(stats['latency_p95_ms'])
+        http_clients.reset_stats()
+        self.assertEqual(self.stats()['requests'], 0)
+
+    def test_httpx_client_is_counted_and_throttled(self):
+        import httpx
+
+        client = http_clients.httpx_client(self.name, timeout=5)
+        shared = http_clients.integration(self.name)
+        shared.pacer = http_clients.Pacer(clock=self.clock, sleep=self.clock.sleep)
+        answer = httpx.Response(429, headers={'Retry-After': '4'})
+        with mock.patch.object(httpx.HTTPTransport, 'handle_request', return_value=answer):
+            client.post('https://vertex.test/v1', json={})
+            client.post('https://vertex.test/v1', json={})
+        self.assertEqual(self.stats()['status'], {'4xx': 2})
+        self.assertEqual(self.clock.slept, [4.0])
+
+
+if __name__ == "__main__":
+    unittest.main()
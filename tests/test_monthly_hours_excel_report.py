@@ -17,7 +17,7 @@ from collections import defaultdict
 from datetime import date
 from io import BytesIO
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 from openpyxl import Workbook, load_workbook
 from openpyxl.cell.rich_text import CellRichText, TextBlock
@@ -25,6 +25,7 @@ from openpyxl.cell.text import InlineFont
 from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
 from openpyxl.utils import get_column_letter
 from tests import source_cache
+import xlsx_stream
 
 
 ROOT = Path(__file__).resolve().parents[1]
@@ -50,6 +51,7 @@ def _load_report_builder():
         "Any": Any,
         "Dict": Dict,
         "List": List,
+        "Optional": Optional,
         "Tuple": Tuple,
         "Alignment": Alignment,
         "Border": Border,
@@ -69,6 +71,7 @@ def _load_report_builder():
         "get_column_letter": get_column_letter,
         "logging": logging,
         "re": re,
+        "xlsx_stream": xlsx_stream,
     }
     exec(compile(method_source, str(DATABASE_PATH), "exec"), namespace)
     return namespace["generate_excel_report_from_view"]
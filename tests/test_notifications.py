@@ -9,12 +9,14 @@
 списки сверяются по исходникам.
 """
 
+import json
 import re
 import unittest
+from unittest import mock
 from datetime import datetime, timedelta
 from pathlib import Path
 
-from notifications import realtime, sources
+from notifications import cache, realtime, sources
 from tests import prod_db
 
 ROOT = Path(__file__).resolve().parents[1]
@@ -793,26 +795,157 @@ class SeenEndpointTest(unittest.TestCase):
         self.assertEqual([], self.executed)
 
 
+class SummaryCacheTest(unittest.TestCase):
+    """Кеш сводки: пересчитывается только то, о чём сообщил триггер."""
+
+    def setUp(self):
+        self.original = dict(sources._HANDLERS)
+        self.original_next_change = sources.next_change_at
+        self.calls = []
+        sources._HANDLERS.clear()
+        for name in ('tasks', 'events', 'surveys'):
+            sources._HANDLERS[name] = self._handler(name)
+        sources.next_change_at = lambda cursor, viewer: (self.calls.append('next_change'), None)[1]
+        self.now = [0.0]
+        self.cache = cache.SummaryCache(max_age_seconds=60, clock=lambda: self.now[0])
+
+    def tearDown(self):
+        sources._HANDLERS.clear()
+        sources._HANDLERS.update(self.original)
+        sources.next_change_at = self.original_next_change
+
+    def _handler(self, name):
+        def handler(cursor, viewer, limit):
+            self.calls.append(name)
+            return 1, [_item(name, '%s для %s' % (name, viewer['user_id']))]
+        return handler
+
+    def _collect(self, user_id, **viewer):
+        self.calls.clear()
+        return sources.collect(FakeCursor(), dict(viewer, user_id=user_id), cache=self.cache)
+
+    def test_second_read_comes_from_cache(self):
+        first = self._collect(1)
+        self.assertEqual(['tasks', 'surveys', 'events', 'next_change'], self.calls)
+        second = self._collect(1)
+        self.assertEqual([], self.calls)
+        self.assertEqual(first, second)
+
+    def test_addressed_invalidation_recomputes_one_source_of_one_user(self):
+        self._collect(1)
+        self._collect(2)
+        self.cache.invalidate(frozenset({1}), 'tasks')
+        self._collect(1)
+        self.assertEqual(['tasks', 'next_change'], self.calls,
+                         'сроки задач читает next_change_at — он тоже пересчитан')
+        self._collect(2)
+        self.assertEqual([], self.calls)
+
+    def test_broadcast_invalidation_hits_one_source_of_everyone(self):
+        self._collect(1)
+        self._collect(2)
+        self.cache.invalidate(None, 'events')
+        for user_id in (1, 2):
+            self._collect(user_id)
+            self.assertEqual(['events'], self.calls)
+
+    def test_tick_without_source_recomputes_the_whole_user(self):
+        self._collect(1)
+        self.cache.invalidate(frozenset({1}))
+        self._collect(1)
+        self.assertEqual(['tasks', 'surveys', 'events', 'next_change'], self.calls)
+
+    def test_invalidation_during_compute_is_not_overwritten(self):
+        """Сброс, пришедший, пока источник считался, сильнее его результата."""
+        def racing(cursor, viewer, limit):
+            self.calls.append('tasks')
+            self.cache.invalidate(frozenset({1}), 'tasks')
+            return 1, []
+
+        sources._HANDLERS['tasks'] = racing
+        self._collect(1)
+        self._collect(1)
+        self.assertIn('tasks', self.calls)
+
+    def test_viewer_change_limit_and_age_drop_entries(self):
+        self._collect(1, department_id=3)
+        self._collect(1, department_id=4)
+        self.assertEqual(3, self.calls.count('tasks') + self.calls.count('surveys')
+                         + self.calls.count('events'))
+        self.now[0] += 61
+        self._collect(1, department_id=4)
+        self.assertIn('events', self.calls)
+
+    def test_next_change_moment_expires_the_user(self):
+        sources.next_change_at = lambda cursor, viewer: (
+            self.calls.append('next_change'), sources._almaty_now() + timedelta(seconds=30))[1]
+        self._collect(1)
+        self.now[0] += 31
+        self._collect(1)
+        self.assertEqual(['tasks', 'surveys', 'events', 'next_change'], self.calls)
+
+    def test_broken_source_is_not_cached(self):
+        def explode(cursor, viewer, limit):
+            self.calls.append('events')
+            raise RuntimeError('boom')
+
+        sources._HANDLERS['events'] = explode
+        with self.assertLogs(level='ERROR'):
+            self._collect(1)
+        with self.assertLogs(level='ERROR'):
+            self._collect(1)
+        self.assertEqual(['events'], self.calls)
+
+    def test_reset_drops_everything(self):
+        self._collect(1)
+        self.cache.invalidate_all()
+        self._collect(1)
+        self.assertEqual(['tasks', 'surveys', 'events', 'next_change'], self.calls)
+
+
 class RealtimeStateMixin:
     """Модуль realtime держит состояние процесса — тесты обязаны его вернуть."""
 
     def setUp(self):
-        self._saved = (list(realtime._ticks), realtime._seq,
-                       realtime._active_streams, realtime._listener_started)
+        self._saved = (list(realtime._ticks), realtime._seq, realtime._mark,
+                       dict(realtime._event_index), list(realtime._broadcast_event_ids),
+                       realtime._active_streams, realtime._listener_started,
+                       realtime._listener_live, realtime._broadcast_due_at,
+                       realtime._broadcast_sources, set(realtime._broadcast_rows),
+                       realtime.summary_cache)
         realtime._ticks.clear()
         realtime._seq = 0
+        realtime._mark = 0
+        realtime._event_index.clear()
+        del realtime._broadcast_event_ids[:]
         realtime._active_streams = 0
         # Слушатель в тестах не поднимается: базы нет, поток крутился бы в
         # цикле переподключений до конца прогона.
         realtime._listener_started = True
+        realtime._listener_live = False
+        realtime._broadcast_due_at = None
+        realtime._broadcast_sources = set()
+        realtime._broadcast_rows.clear()
+        realtime.summary_cache = cache.SummaryCache()
 
     def tearDown(self):
-        ticks, seq, streams, started = self._saved
+        (ticks, seq, mark, event_index, broadcast_event_ids, streams, started, live, due_at,
+         broadcast_sources, broadcast_rows, summary_cache) = self._saved
         realtime._ticks.clear()
         realtime._ticks.extend(ticks)
         realtime._seq = seq
+        realtime._mark = mark
+        realtime._event_index.clear()
+        realtime._event_index.update(event_index)
+        realtime._broadcast_event_ids[:] = broadcast_event_ids
         realtime._active_streams = streams
         realtime._listener_started = started
+        realtime._listener_live = live
+        realtime._broadcast_due_at = due_at
+        realtime._broadcast_sources = broadcast_sources
+        realtime._broadcast_rows.clear()
+        realtime._broadcast_rows.update(broadcast_rows)
+        realtime.summary_cache = summary_cache
 
 
 class RealtimeTicksTest(RealtimeStateMixin, unittest.TestCase):
@@ -828,6 +961,105 @@ class RealtimeTicksTest(RealtimeStateMixin, unittest.TestCase):
         self.assertIs(False, realtime._parse_payload('{"u":[]}'))
         self.assertIs(False, realtime._parse_payload(''))
 
+    def test_payload_source_and_row(self):
+        self.assertEqual((frozenset({3}), 'tasks', 41, 500),
+                         realtime._parse_notify('{"u":[3],"s":"tasks","r":41,"i":500}'))
+        self.assertEqual((None, 'events', 7, None),
+                         realtime._parse_notify('{"b":1,"s":"events","r":7}'))
+        self.assertEqual((frozenset({3}), 'events', None, None),
+                         realtime._parse_notify('{"u":[3],"s":"events","r":null,"i":"x"}'))
+        self.assertEqual((frozenset({3}), None, None, None), realtime._parse_notify('{"u":[3]}'),
+                         'старый триггер')
+        self.assertIs(False, realtime._parse_notify('не-json')[0])
+
+    def test_drain_invalidates_cache_and_coalesces_broadcasts(self):
+        class Note:
+            def __init__(self, payload):
+                self.payload = payload
+
+        class Connection:
+            notifies = [Note('{"u":[5],"s":"tasks","r":3}'),
+                        Note('{"b":1,"s":"events","r":8}'), Note('{"b":1,"s":"four_you","r":9}')]
+
+        viewer = {'user_id': 5}
+        epoch, _ = realtime.summary_cache.lookup(viewer, 5)
+        for name in ('tasks', 'events', 'lms'):
+            realtime.summary_cache.store(viewer, 5, epoch, name, (0, []))
+
+        realtime._drain_notifies(Connection())
+
+        self.assertEqual({'lms'}, set(realtime.summary_cache.lookup(viewer, 5)[1]))
+        # Адресный ушёл сразу, два широковещательных ждут окна склейки.
+        self.assertEqual(1, realtime.current_seq())
+        self.assertFalse(realtime._flush_broadcast(now=realtime._broadcast_due_at - 0.01))
+        self.assertTrue(realtime._flush_broadcast(now=realtime._broadcast_due_at))
+        self.assertEqual(2, realtime.current_seq(), 'два широковещательных — один тычок')
+        poked, _ = realtime.wait_for_tick(1, 99, 0.1)
+        self.assertTrue(poked)
+        self.assertFalse(realtime._flush_broadcast())
+        changes, _ = realtime.poll_changes(0, 5)
+        self.assertEqual(frozenset({'tasks', 'events', 'four_you'}), changes.sources)
+        self.assertEqual(frozenset({('tasks', 3), ('events', 8), ('four_you', 9)}), changes.rows)
+
+    def test_changes_accumulate_only_the_viewers_sources(self):
+        realtime._publish(frozenset({5}), frozenset({'tasks'}), frozenset({('tasks', 1)}))
+        realtime._publish(frozenset({6}), frozenset({'crm'}), frozenset({('crm', 2)}))
+        realtime._publish(None, frozenset({'events'}))
+
+        changes, seq = realtime.poll_changes(0, 5)
+        self.assertEqual(3, seq)
+        self.assertEqual(frozenset({'tasks', 'events'}), changes.sources)
+        self.assertEqual(frozenset({('tasks', 1)}), changes.rows)
+        self.assertIsNone(realtime.poll_changes(seq, 5)[0])
+        changes, _ = realtime.wait_for_changes(0, 7, 0.1)
+        self.assertEqual(frozenset({'events'}), changes.sources)
+
+    def test_unknown_source_or_gap_means_full_reload(self):
+        realtime._publish(frozenset({5}), frozenset({'tasks'}))
+        realtime._publish(None)  # сверка после LISTEN: что изменилось — неизвестно
+        self.assertIsNone(realtime.poll_changes(0, 5)[0].sources)
+
+        for _ in range(realtime.TICK_BUFFER_MAXLEN + 1):
+            realtime._publish(frozenset({999}), frozenset({'tasks'}))
+        self.assertIsNone(realtime.poll_changes(1, 5)[0].sources, 'курсор выпал из кольца')
+
+    def _publish_at(self, at, targets, event_ids):
+        with mock.patch.object(realtime.time, 'monotonic', return_value=at):
+            realtime._publish(targets, frozenset({'tasks'}), event_ids=event_ids)
+
+    def test_resume_by_global_cursor(self):
+        self.assertEqual((0, True), realtime.resume_seq(None))
+        self.assertEqual((0, False), realtime.resume_seq(5), 'курсора нет в кольце')
+        # Сквозные номера идут не по возрастанию: nextval раньше коммита.
+        self._publish_at(100.0, frozenset({5}), (31,))
+        self._publish_at(110.0, frozenset({5}), (30,))
+        self._publish_at(120.0, None, (33, 32))
+        self.assertEqual(30, realtime.cursor_id(2))
+        self.assertEqual(32, realtime.cursor_id(3))
+        self.assertEqual((2, True), realtime.resume_seq(30))
+        self.assertEqual((2, True), realtime.resume_seq(33),
+                         'в тычок влито ещё и 32 — он уходит заново')
+        self.assertEqual((3, True), realtime.resume_seq(32))
+        self.assertEqual((3, True), realtime.resume_seq(None))
+
+    def test_resume_rewinds_over_the_coalescing_window(self):
+        """Склейка соседнего процесса могла поставить широковещательный тычок после курсора."""
+        self._publish_at(100.0, frozenset({5}), (1,))
+        self._publish_at(109.5, None, (3,))
+        self._publish_at(110.0, frozenset({5}), (2,))
+        self.assertEqual((1, True), realtime.resume_seq(2))
+        self.assertEqual((2, True), realtime.resume_seq(3))
+
+    def test_evicted_cursor_is_not_covered(self):
+        realtime._publish(frozenset({5}), frozenset({'tasks'}), event_ids=(1,))
+        for event_id in range(2, realtime.TICK_BUFFER_MAXLEN + 2):
+            realtime._publish(frozenset({5}), frozenset({'tasks'}), event_ids=(event_id,))
+        self.assertNotIn(1, realtime._event_index)
+        self.assertEqual((realtime.current_seq(), False), realtime.resume_seq(1))
+        self.assertEqual(0, realtime.cursor_id(1))
+        # Соседи в пределах окна склейки тоже в кольце, но отступ упирается в начало.
+        self.assertEqual((realtime.current_seq(), False), realtime.resume_seq(2))
+
     def test_targeted_tick_reaches_only_its_user(self):
         realtime._publish(frozenset({5}))
         poked, seq = realtime.wait_for_tick(0, 5, 0.1)
@@ -869,9 +1101,13 @@ class RealtimeTicksTest(RealtimeStateMixin, unittest.TestCase):
                 return Cursor()
 
         connection = Connection()
+        realtime.summary_cache.store({'user_id': 1}, 5, 0, 'tasks', (0, []))
         realtime._subscribe(connection)
 
         self.assertEqual({'autocommit': True}, connection.session)
+        self.assertTrue(realtime.listener_live())
+        self.assertEqual({}, realtime.summary_cache.lookup({'user_id': 1}, 5)[1],
+                         'сбросы из окна переподключения потеряны — кеш с нуля')
         self.assertEqual(['LISTEN %s' % realtime.BELL_NOTIFY_CHANNEL], commands)
         for user_id in (1, 99):
             poked, _ = realtime.wait_for_tick(0, user_id, 0.1)
@@ -962,6 +1198,76 @@ class StreamEndpointTest(RealtimeStateMixin, unittest.TestCase):
         finally:
             realtime.HEARTBEAT_SECONDS = original_heartbeat
 
+    def _delta_client(self):
+        import contextlib
+        from flask import Flask
+        from notifications.routes import build_notifications_blueprint
+
+        class Db:
+            @contextlib.contextmanager
+            def _get_cursor(self):
+                yield FakeCursor()
+
+        original = dict(sources._HANDLERS)
+        self.addCleanup(lambda: (sources._HANDLERS.clear(), sources._HANDLERS.update(original)))
+        sources._HANDLERS.clear()
+        sources._HANDLERS.update({
+            'tasks': lambda c, v, limit: (1, [_item('tasks', 'Задача')]),
+            'events': lambda c, v, limit: (2, [_item('events', 'Пост')]),
+        })
+        app = Flask(__name__)
+        app.register_blueprint(build_notifications_blueprint(
+            db=Db(),
+            require_api_key=lambda f: f,
+            build_cors_preflight_response=lambda: ('', 204),
+            resolve_requester=lambda: (2, None, None),
+            viewer_context=lambda rid, r: {'user_id': rid},
+            listen_connect=lambda: None,
+            stream_deltas=True,
+        ))
+        return app.test_client()
+
+    def _open(self, client, url):
+        response = client.get(url, buffered=False)
+        self.addCleanup(response.close)
+        stream = response.response if hasattr(response.response, '__next__') \
+            else iter(response.response)
+        self.assertIn(b'connected', next(stream))
+        return stream
+
+    def test_delta_mode_pushes_the_recomputed_source(self):
+        stream = self._open(self._delta_client(), '/api/notifications/stream?mode=delta&limit=7')
+
+        realtime._publish(frozenset({2}), frozenset({'events'}), frozenset({('events', 9)}),
+                          event_ids=(740,))
+        frame = next(stream).decode('utf-8')
+
+        # В id: — сквозной курсор, а не номер тычка процесса.
+        self.assertTrue(frame.startswith('id: 740\nevent: delta\n'), frame)
+        delta = json.loads(frame.split('data: ', 1)[1])
+        self.assertEqual(740, delta['seq'])
+        self.assertEqual(['events'], delta['sources'])
+        self.assertEqual({'events': [9]}, delta['rows'])
+        self.assertEqual(7, delta['limit'])
+        self.assertEqual(3, delta['counts']['total'], 'счётчики — целиком')
+        self.assertEqual(['Пост'], [item['title'] for item in delta['items']],
+                         'элементы — только изменившегося источника')
+        self.assertEqual(list(sources.SOURCES), delta['order'])
+
+    def test_delta_mode_falls_back_to_reload(self):
+        client = self._delta_client()
+        stream = self._open(client, '/api/notifications/stream?mode=delta&after=40')
+        self.assertEqual(b'id: 0\nevent: reload\ndata: {}\n\n', next(stream),
+                         'курсор вне кольца — полная перечитка')
+
+        realtime._publish(frozenset({2}))  # тычок без источника
+        self.assertIn(b'event: reload', next(stream))
+
+    def test_plain_mode_stays_on_reload_pokes(self):
+        stream = self._open(self._delta_client(), '/api/notifications/stream')
+        realtime._publish(frozenset({2}), frozenset({'events'}))
+        self.assertEqual(b'event: reload\ndata: {}\n\n', next(stream))
+
     def test_no_periodic_reconcile_constant_remains(self):
         """Константа интервала сверки не должна вернуться ни в каком виде."""
         self.assertFalse(hasattr(realtime, 'RECONCILE_SECONDS'))
@@ -1037,6 +1343,23 @@ class RealtimeTriggersPinnedTest(unittest.TestCase):
             'лишняя — триггера нет, недостающая — источник без проверки',
         )
 
+    def test_payload_names_a_real_source_for_every_table(self):
+        """Имя источника в payload — ключ кеша сводки: опечатка = вечный кеш."""
+        block = self._trigger_block()
+        start = block.index('bell_source TEXT := CASE')
+        case = block[start:block.index('END;', start)]
+        mapped = set()
+        for tables, name in re.findall(r"WHEN TG_TABLE_NAME (?:IN \(|= )([^)]*?)\)? THEN '(\w+)'", case):
+            self.assertIn(name, sources.SOURCES)
+            mapped.update(re.findall(r"'(\w+)'", tables))
+        self.assertEqual(set(self.BELL_TRIGGER_TABLES), mapped)
+        self.assertIn("json_build_object('b', 1, 's', bell_source, 'r', NEW.id,", block)
+        self.assertIn("json_build_object('u', targets, 's', bell_source,", block)
+        self.assertIn("'r', bell_row,", block)
+        # Сквозной курсор — из одной последовательности на все процессы.
+        self.assertEqual(2, block.count("'i', nextval('bell_event_seq')"))
+        self.assertIn('CREATE SEQUENCE IF NOT EXISTS bell_event_seq', self.DATABASE)
+
     def test_watermark_updates_wake_only_the_same_user(self):
         block = self._trigger_block()
         self.assertIn("TG_TABLE_NAME IN ('event_reads', 'four_you_reads')", block)
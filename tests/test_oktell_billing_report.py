@@ -9,6 +9,7 @@ bot_schedule2.py через AST и исполняются в изолирова
 """
 
 import ast
+import logging
 import re
 import textwrap
 import unittest
@@ -31,6 +32,8 @@ FUNCTION_NAMES = [
     "_oktell_billing_parse_time",
     "_oktell_billing_minute_filter",
     "_oktell_billing_sql",
+    "_oktell_billing_fetch_windows",
+    "_oktell_billing_days_rows",
     "_oktell_fetch_billing_rows",
     "_oktell_billing_int",
     "_oktell_billing_sec",
@@ -61,6 +64,7 @@ FUNCTION_NAMES = [
 
 CONST_NAMES = (
     "OKTELL_BILLING_MAX_RANGE_DAYS",
+    "OKTELL_BILLING_FORMULA_VERSIONS",
     "_OKTELL_BILLING_PARK_LABELS",
     "_OKTELL_BILLING_LINE_LABELS",
     "_OKTELL_BILLING_EXPORT_DUR_FMT",
@@ -68,7 +72,7 @@ CONST_NAMES = (
 )
 
 
-def _extract_namespace(oktell_query=None, page_size=1000, chunk_days=7):
+def _extract_namespace(oktell_query=None, page_size=1000, chunk_days=7, day_cache=None, today=None):
     module = source_cache.parse(BOT_PATH.read_text(encoding="utf-8"))
     wanted = set(FUNCTION_NAMES)
     selected = [
@@ -107,7 +111,13 @@ def _extract_namespace(oktell_query=None, page_size=1000, chunk_days=7):
         ),
         "OKTELL_API_PAGE_SIZE": page_size,
         "OKTELL_RESOURCE_CHUNK_DAYS": chunk_days,
-        "_oktell_query": oktell_query or (lambda sql: []),
+        "_oktell_query": oktell_query or (lambda sql, **_kwargs: []),
+        # Кэш закрытых суток по умолчанию выключен: эти тесты про запросы к Oktell.
+        "OKTELL_BILLING_DAY_CACHE_ENABLED": day_cache is not None,
+        "OKTELL_BILLING_DAY_CACHE_SETTLE_DAYS": 0,
+        "db": day_cache,
+        "_oktell_today": lambda: today or date(2026, 9, 10),
+        "logging": logging,
     }
     exec(compile(ast.Module(body=consts + selected, type_ignores=[]), str(BOT_PATH), "exec"), ns)
     return ns
@@ -307,7 +317,7 @@ class BillingDetailTests(unittest.TestCase):
             ],
         ]
 
-        def fake_query(sql):
+        def fake_query(sql, **_kwargs):
             calls.append(sql)
             return pages[len(calls) - 1]
 
@@ -613,19 +623,22 @@ class BuildOperatorReportTests(unittest.TestCase):
     def test_operator_fetch_runs_two_queries_per_chunk(self):
         calls = []
 
-        def fake_query(sql):
+        def fake_query(sql, **_kwargs):
             calls.append(sql)
             return [{"n": len(calls)}]
 
         ns = _extract_namespace(oktell_query=fake_query, chunk_days=7)
         calls_rows, states_rows = ns["_oktell_fetch_billing_operator_rows"](
             date(2026, 7, 1), date(2026, 7, 10), 0, 1439)
-        # 10 дней = 2 чанка, по 2 запроса на чанк
+        # 10 дней = 2 чанка, по 2 запроса на чанк; у звонков и состояний свои сутки в кэше,
+        # поэтому сначала все окна звонков, потом все окна состояний
         self.assertEqual(len(calls), 4)
         self.assertEqual(len(calls_rows), 2)
         self.assertEqual(len(states_rows), 2)
         self.assertIn("Call_Systems_hst", calls[0])
-        self.assertIn("A_Cube_CC_OperatorStates", calls[1])
+        self.assertIn("Call_Systems_hst", calls[1])
+        self.assertIn("A_Cube_CC_OperatorStates", calls[2])
+        self.assertIn("A_Cube_CC_OperatorStates", calls[3])
 
     def test_efficiency_workbook_matches_grouped_template(self):
         ns = _extract_namespace()
@@ -780,9 +793,11 @@ class BillingEfficiencyDataTests(unittest.TestCase):
 class FetchChunkingTests(unittest.TestCase):
     def test_chunks_are_serial_windows(self):
         calls = []
+        closed_days = []
 
-        def fake_query(sql):
+        def fake_query(sql, **kwargs):
             calls.append(sql)
+            closed_days.append(kwargs.get("closed_day"))
             return [{"report_date": "x"}]
 
         ns = _extract_namespace(oktell_query=fake_query, chunk_days=7)
@@ -796,11 +811,13 @@ class FetchChunkingTests(unittest.TestCase):
         self.assertIn("'20260715'", calls[2])
         self.assertIn("'20260717'", calls[2])
         self.assertEqual(len(rows), 3)
+        # Кэш шлюза смотрит на последний день окна: окно с сегодняшним днём не кэшируется.
+        self.assertEqual(closed_days, [date(2026, 7, 7), date(2026, 7, 14), date(2026, 7, 16)])
 
     def test_truncated_window_falls_back_to_days(self):
         calls = []
 
-        def fake_query(sql):
+        def fake_query(sql, **_kwargs):
             calls.append(sql)
             # первое (оконное) обращение упирается в лимит, дневные — нет
             if len(calls) == 1:
@@ -816,7 +833,7 @@ class FetchChunkingTests(unittest.TestCase):
     def test_single_day_truncated_keeps_page(self):
         calls = []
 
-        def fake_query(sql):
+        def fake_query(sql, **_kwargs):
             calls.append(sql)
             return [{"n": i} for i in range(5)]
 
@@ -827,5 +844,101 @@ class FetchChunkingTests(unittest.TestCase):
         self.assertEqual(len(rows), 5)
 
 
+class _DayCache:
+    """oktell_billing_days в памяти: {(kind, variant, day): (version, rows)}."""
+
+    def __init__(self, entries=None):
+        self.entries = dict(entries or {})
+        self.saved = []
+
+    def get_oktell_billing_days(self, kind, variant, date_from, date_to, formula_version):
+        return {
+            day: rows
+            for (k, v, day), (version, rows) in self.entries.items()
+            if k == kind and v == variant and date_from <= day <= date_to and version == formula_version
+        }
+
+    def save_oktell_billing_days(self, kind, variant, days, formula_version):
+        self.saved.append((kind, sorted(days)))
+        for day, rows in days.items():
+            self.entries[(kind, variant, day)] = (formula_version, list(rows))
+
+
+class ClosedDayCacheTests(unittest.TestCase):
+    VARIANT = "0-1439:sl20"
+
+    def _fetch_calls(self, cache, range_from, range_to, today):
+        calls = []
+
+        def fake_query(sql, **kwargs):
+            calls.append(sql)
+            day_from = re.search(r"t\.dt_insert >= '(\d{8})'", sql).group(1)
+            report_date = datetime.strptime(day_from, "%Y%m%d").date().isoformat()
+            return [{"report_date": report_date, "taxi_park": "iTaxi", "arrived": 1}]
+
+        ns = _extract_namespace(oktell_query=fake_query, day_cache=cache, today=today)
+        rows = ns["_oktell_fetch_billing_rows"](range_from, range_to, 0, 1439, 20)
+        return rows, calls
+
+    def test_month_is_a_local_rollup_plus_one_live_query_for_today(self):
+        cache = _DayCache({
+            ("park", self.VARIANT, date(2026, 9, 1) + timedelta(days=i)): (1, [{"report_date": "cached"}])
+            for i in range(9)
+        })
+        rows, calls = self._fetch_calls(cache, date(2026, 9, 1), date(2026, 9, 10), date(2026, 9, 10))
+        self.assertEqual(1, len(calls))
+        self.assertIn("'20260910'", calls[0])
+        self.assertEqual(["cached"] * 9 + ["2026-09-10"], [row["report_date"] for row in rows])
+        self.assertEqual([], cache.saved)
+
+    def test_missing_closed_days_are_fetched_once_and_stored(self):
+        cache = _DayCache({("park", self.VARIANT, date(2026, 9, 2)): (1, [])})
+        rows, calls = self._fetch_calls(cache, date(2026, 9, 1), date(2026, 9, 4), date(2026, 9, 10))
+        # Пробелы 01 и 03-04 — по окну на каждый; 02 — «звонков не было», из кэша.
+        self.assertEqual(2, len(calls))
+        self.assertEqual([("park", [date(2026, 9, 1)]),
+                          ("park", [date(2026, 9, 3), date(2026, 9, 4)])], cache.saved)
+        self.assertEqual(["2026-09-01", "2026-09-03"], [row["report_date"] for row in rows])
+        self.assertEqual([], cache.entries[("park", self.VARIANT, date(2026, 9, 4))][1])
+
+        rows_again, calls_again = self._fetch_calls(cache, date(2026, 9, 1), date(2026, 9, 4), date(2026, 9, 10))
+        self.assertEqual([], calls_again)
+        self.assertEqual(rows, rows_again)
+
+    def test_other_formula_version_is_not_served(self):
+        cache = _DayCache({("park", self.VARIANT, date(2026, 9, 1)): (0, [{"report_date": "stale"}])})
+        rows, calls = self._fetch_calls(cache, date(2026, 9, 1), date(2026, 9, 1), date(2026, 9, 10))
+        self.assertEqual(1, len(calls))
+        self.assertEqual("2026-09-01", rows[0]["report_date"])
+        self.assertEqual(1, cache.entries[("park", self.VARIANT, date(2026, 9, 1))][0])
+
+    def test_states_fixed_after_the_9_10_swap_carry_their_own_version(self):
+        ns = _extract_namespace()
+        versions = ns["OKTELL_BILLING_FORMULA_VERSIONS"]
+        self.assertGreater(versions["operator_states"], 1)
+        self.assertEqual({"park", "line", "operator_calls", "operator_states"}, set(versions))
+
+    def test_cache_outage_falls_back_to_live_queries(self):
+        class _Broken(_DayCache):
+            def get_oktell_billing_days(self, *args):
+                raise RuntimeError("pool exhausted")
+
+        with self.assertLogs(level="ERROR"):
+            rows, calls = self._fetch_calls(_Broken(), date(2026, 9, 1), date(2026, 9, 3), date(2026, 9, 10))
+        self.assertEqual(1, len(calls))
+        self.assertEqual(1, len(rows))
+
+    def test_storage_sql_keys_days_by_kind_variant_and_version(self):
+        source = DATABASE_PATH.read_text(encoding="utf-8-sig")
+        schema = ast.unparse(source_cache.function_node(
+            DATABASE_PATH, "_init_oktell_billing_days_schema_tx", class_name="Database"))
+        self.assertIn("PRIMARY KEY (kind, variant, report_date)", schema)
+        self.assertIn("formula_version INTEGER NOT NULL", schema)
+        read = ast.unparse(source_cache.function_node(
+            DATABASE_PATH, "get_oktell_billing_days", class_name="Database"))
+        self.assertIn("formula_version = %s", read)
+        self.assertIn("self._init_oktell_billing_days_schema_tx(cursor)", source)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,226 @@
+"""Общий шлюз к прокси Oktell (oktell_gateway.py): склейка, кэш закрытых дней, очередь.
+
+Сетевой вызов подменяется функцией: шлюз о HTTP ничего не знает, а вся логика
+(кто идёт в прокси, кто ждёт, кто получает кэш) живёт в нём самом.
+"""
+
+import ast
+import sys
+import threading
+import time
+import unittest
+from datetime import date
+from pathlib import Path
+
+from tests import source_cache
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import oktell_gateway  # noqa: E402
+
+BOT_PATH = ROOT / "bot_schedule2.py"
+TODAY = date(2026, 9, 10)
+
+
+class _Proxy:
+    """Прокси, который держит запрос, пока тест не отпустит gate."""
+
+    def __init__(self, gate=None):
+        self.gate = gate
+        self.calls = []
+        self.lock = threading.Lock()
+        self.started = threading.Event()
+
+    def __call__(self, sql, timeout=None):
+        with self.lock:
+            self.calls.append(sql)
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        if sql == 'BROKEN':
+            raise RuntimeError('Oktell proxy HTTP 500')
+        return [{'sql': sql}]
+
+
+def _gateway(proxy, **kwargs):
+    kwargs.setdefault('today', lambda: TODAY)
+    return oktell_gateway.OktellGateway(proxy, **kwargs)
+
+
+def _spawn(target, *args, **kwargs):
+    thread = threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True)
+    thread.start()
+    return thread
+
+
+def _wait_until(predicate, seconds=2.0):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return False
+
+
+class CoalescingTest(unittest.TestCase):
+    def test_identical_queries_share_one_proxy_call(self):
+        gate = threading.Event()
+        proxy = _Proxy(gate)
+        gateway = _gateway(proxy)
+        results = []
+
+        leader = _spawn(lambda: results.append(gateway.query('SELECT 1', consumer='route:a')))
+        proxy.started.wait(2)
+        followers = [_spawn(lambda: results.append(gateway.query('SELECT 1', consumer='route:b')))
+                     for _ in range(3)]
+        self.assertTrue(_wait_until(
+            lambda: any(row['consumer'] == 'route:b' and row['coalesced'] == 3
+                        for row in gateway.snapshot()['consumers'])))
+        gate.set()
+        for thread in [leader] + followers:
+            thread.join(2)
+
+        self.assertEqual(['SELECT 1'], proxy.calls)
+        self.assertEqual([[{'sql': 'SELECT 1'}]] * 4, results)
+        # Копии, а не общий список: правка одного потребителя не видна другому.
+        results[0][0]['sql'] = 'испорчено'
+        self.assertEqual('SELECT 1', results[1][0]['sql'])
+
+    def test_followers_get_the_leaders_error(self):
+        gate = threading.Event()
+        proxy = _Proxy(gate)
+        gateway = _gateway(proxy)
+        errors = []
+
+        def _call():
+            try:
+                gateway.query('BROKEN', consumer='route:a')
+            except RuntimeError as exc:
+                errors.append(str(exc))
+
+        threads = [_spawn(_call)]
+        proxy.started.wait(2)
+        threads.append(_spawn(_call))
+        self.assertTrue(_wait_until(lambda: gateway.snapshot()['consumers'][0]['coalesced'] == 1))
+        gate.set()
+        for thread in threads:
+            thread.join(2)
+        self.assertEqual(['Oktell proxy HTTP 500'] * 2, errors)
+        self.assertEqual(1, len(proxy.calls))
+        self.assertEqual(1, gateway.snapshot()['consumers'][0]['errors'])
+
+    def test_follower_with_timeout_gives_up_like_the_queue(self):
+        gate = threading.Event()
+        proxy = _Proxy(gate)
+        gateway = _gateway(proxy)
+        leader = _spawn(gateway.query, 'SELECT slow', consumer='job:sync')
+        proxy.started.wait(2)
+
+        started = time.monotonic()
+        with self.assertRaises(oktell_gateway.OktellGatewayBusy):
+            gateway.query('SELECT slow', 0.05, consumer='route:wallboard')
+        self.assertLess(time.monotonic() - started, 2)
+        gate.set()
+        leader.join(2)
+        self.assertEqual(1, len(proxy.calls))
+        stats = {row['consumer']: row for row in gateway.snapshot()['consumers']}
+        self.assertEqual(1, stats['route:wallboard']['busy'])
+
+
+class ClosedDayCacheTest(unittest.TestCase):
+    def test_closed_day_is_served_from_cache(self):
+        proxy = _Proxy()
+        gateway = _gateway(proxy)
+        first = gateway.query('SELECT day', closed_day=date(2026, 9, 9), consumer='route:a')
+        first[0]['sql'] = 'правка вызывающего'
+        second = gateway.query('SELECT day', closed_day=date(2026, 9, 9), consumer='route:a')
+        self.assertEqual(1, len(proxy.calls))
+        self.assertEqual([{'sql': 'SELECT day'}], second)
+        self.assertEqual(1, gateway.snapshot()['consumers'][0]['cache_hits'])
+
+    def test_open_day_and_uncached_calls_always_hit_the_proxy(self):
+        proxy = _Proxy()
+        gateway = _gateway(proxy)
+        for _ in range(2):
+            gateway.query('SELECT today', closed_day=TODAY)
+            gateway.query('SELECT sync')
+        self.assertEqual(4, len(proxy.calls))
+
+    def test_ttl_and_row_budget(self):
+        now = [100.0]
+        proxy = _Proxy()
+        gateway = _gateway(proxy, cache_ttl_seconds=60, cache_max_rows=2, clock=lambda: now[0])
+        day = date(2026, 9, 1)
+        gateway.query('A', closed_day=day)
+        now[0] += 61
+        gateway.query('A', closed_day=day)
+        self.assertEqual(['A', 'A'], proxy.calls)
+
+        # Бюджет — две строки: третья запись вытесняет самую давнюю.
+        gateway.query('B', closed_day=day)
+        gateway.query('C', closed_day=day)
+        self.assertEqual(2, gateway.snapshot()['cache']['rows'])
+        gateway.query('A', closed_day=day)
+        self.assertEqual(['A', 'A', 'B', 'C', 'A'], proxy.calls)
+
+
+class PrioritySlotsTest(unittest.TestCase):
+    def test_released_slot_goes_to_the_most_urgent_waiter(self):
+        slots = oktell_gateway._PrioritySlots(1)
+        self.assertTrue(slots.acquire(oktell_gateway.PRIORITY_SYNC))
+        order = []
+
+        def _wait(priority):
+            slots.acquire(priority)
+            order.append(priority)
+            slots.release()
+
+        threads = [_spawn(_wait, oktell_gateway.PRIORITY_SYNC)]
+        self.assertTrue(_wait_until(lambda: slots.state()['queued'] == 1))
+        threads.append(_spawn(_wait, oktell_gateway.PRIORITY_WALLBOARD))
+        self.assertTrue(_wait_until(lambda: slots.state()['queued'] == 2))
+        slots.release()
+        for thread in threads:
+            thread.join(2)
+        self.assertEqual([oktell_gateway.PRIORITY_WALLBOARD, oktell_gateway.PRIORITY_SYNC], order)
+        self.assertEqual({'slots': 1, 'in_use': 0, 'queued': 0}, slots.state())
+
+    def test_wallboard_gives_up_instead_of_queueing_forever(self):
+        gate = threading.Event()
+        proxy = _Proxy(gate)
+        gateway = _gateway(proxy, max_concurrency=1)
+        busy = _spawn(gateway.query, 'SELECT slow', consumer='thread:sync')
+        proxy.started.wait(2)
+        with self.assertRaises(oktell_gateway.OktellGatewayBusy):
+            gateway.query('SELECT board', 0.05, priority=oktell_gateway.PRIORITY_WALLBOARD,
+                          consumer='route:wallboard')
+        gate.set()
+        busy.join(2)
+        stats = {row['consumer']: row for row in gateway.snapshot()['consumers']}
+        self.assertEqual(1, stats['route:wallboard']['busy'])
+        self.assertEqual(0, stats['route:wallboard']['proxy_queries'])
+        # Отменённое ожидание не съедает слот.
+        self.assertEqual([{'sql': 'SELECT next'}], gateway.query('SELECT next'))
+
+    def test_default_priority_follows_the_consumer_label(self):
+        self.assertEqual(oktell_gateway.PRIORITY_INTERACTIVE,
+                         oktell_gateway.default_priority('route:api_oktell_billing'))
+        self.assertEqual(oktell_gateway.PRIORITY_SYNC,
+                         oktell_gateway.default_priority('thread:oktell-sync'))
+
+
+class WiringTest(unittest.TestCase):
+    def test_every_caller_goes_through_the_gateway(self):
+        tree = source_cache.parse(source_cache.read(BOT_PATH))
+        direct = [
+            node.lineno for node in ast.walk(tree)
+            if isinstance(node, ast.Call) and getattr(node.func, 'id', None) == '_oktell_proxy_query'
+        ]
+        self.assertEqual([], direct)
+        query = source_cache.function_node(BOT_PATH, '_oktell_query')
+        self.assertIn('_oktell_gateway.query', ast.unparse(query))
+
+
+if __name__ == "__main__":
+    unittest.main()
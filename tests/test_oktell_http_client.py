@@ -15,6 +15,8 @@ from http.client import RemoteDisconnected
 from pathlib import Path
 
 import requests
+
+import http_clients
 from tests import source_cache
 
 
@@ -84,7 +86,7 @@ def _namespace(outcomes=(), token='secret', url='http://proxy.test:8085/query'):
     _load_names(source, {
         '_OKTELL_DROPPED_CONNECTION_ERRORS',
         '_oktell_dropped_keepalive',
-        '_oktell_query',
+        '_oktell_proxy_query',
     }, ns)
     ns['_fake_session'] = session
     return ns
@@ -102,14 +104,15 @@ class OktellSessionTests(unittest.TestCase):
 
     def test_query_goes_through_the_shared_session(self):
         ns = _namespace()
-        rows = ns['_oktell_query']("SELECT 1")
+        rows = ns['_oktell_proxy_query']("SELECT 1")
         self.assertEqual(rows, [{'ok': 1}])
         self.assertEqual(len(ns['_fake_session'].calls), 1)
 
     def test_real_session_reuses_one_connection_per_host(self):
         """Пул именно маленький: прокси низкоконкурентный, разгонять его нам нечем."""
         source = (ROOT / "bot_schedule2.py").read_text(encoding="utf-8-sig")
-        ns = _load_names(source, {'_build_oktell_session', '_oktell_session'}, {'requests': requests})
+        ns = _load_names(source, {'_build_oktell_session', '_oktell_session'},
+                         {'requests': requests, 'http_clients': http_clients})
         session = ns['_oktell_session']
         self.assertIsInstance(session, requests.Session)
         adapter = session.get_adapter('http://proxy.test:8085/query')
@@ -118,25 +121,25 @@ class OktellSessionTests(unittest.TestCase):
 
     def test_timeouts_are_split_into_connect_and_read(self):
         ns = _namespace()
-        ns['_oktell_query']("SELECT 1")
+        ns['_oktell_proxy_query']("SELECT 1")
         self.assertEqual(ns['_fake_session'].calls[0][1]['timeout'], (5, 60))
 
     def test_caller_timeout_overrides_only_the_read_half(self):
         """Табло сокращает ожидание ОТВЕТА; хендшейк и так ограничен коротко."""
         ns = _namespace()
-        ns['_oktell_query']("SELECT 1", timeout=20)
+        ns['_oktell_proxy_query']("SELECT 1", timeout=20)
         self.assertEqual(ns['_fake_session'].calls[0][1]['timeout'], (5, 20))
 
     def test_token_is_sent_on_every_request(self):
         ns = _namespace()
-        ns['_oktell_query']("SELECT 1")
+        ns['_oktell_proxy_query']("SELECT 1")
         self.assertEqual(ns['_fake_session'].calls[0][1]['headers'], {"X-API-Key": 'secret'})
         self.assertEqual(ns['_fake_session'].calls[0][1]['json'], {"sql": "SELECT 1"})
 
     def test_http_error_is_reported_with_the_body(self):
         ns = _namespace([_FakeResponse(status_code=500, text='{"detail":"Ошибка БД"}')])
         with self.assertRaises(RuntimeError) as ctx:
-            ns['_oktell_query']("SELECT 1")
+            ns['_oktell_proxy_query']("SELECT 1")
         self.assertIn('500', str(ctx.exception))
         self.assertIn('Ошибка БД', str(ctx.exception))
 
@@ -149,27 +152,27 @@ class OktellRetryTests(unittest.TestCase):
 
     def test_dropped_keepalive_is_retried_once(self):
         ns = _namespace([_dropped_keepalive_error(), _FakeResponse()])
-        rows = ns['_oktell_query']("SELECT 1")
+        rows = ns['_oktell_proxy_query']("SELECT 1")
         self.assertEqual(rows, [{'ok': 1}])
         self.assertEqual(len(ns['_fake_session'].calls), 2)
 
     def test_second_drop_in_a_row_is_not_retried_again(self):
         ns = _namespace([_dropped_keepalive_error(), _dropped_keepalive_error()])
         with self.assertRaises(requests.exceptions.ConnectionError):
-            ns['_oktell_query']("SELECT 1")
+            ns['_oktell_proxy_query']("SELECT 1")
         self.assertEqual(len(ns['_fake_session'].calls), 2)
 
     def test_connect_timeout_is_never_retried(self):
         ns = _namespace([requests.exceptions.ConnectTimeout(
             "Connection to 89.107.98.195 timed out. (connect timeout=5)")])
         with self.assertRaises(requests.exceptions.ConnectTimeout):
-            ns['_oktell_query']("SELECT 1")
+            ns['_oktell_proxy_query']("SELECT 1")
         self.assertEqual(len(ns['_fake_session'].calls), 1)
 
     def test_read_timeout_is_never_retried(self):
         ns = _namespace([requests.exceptions.ReadTimeout("Read timed out. (read timeout=20)")])
         with self.assertRaises(requests.exceptions.ReadTimeout):
-            ns['_oktell_query']("SELECT 1")
+            ns['_oktell_proxy_query']("SELECT 1")
         self.assertEqual(len(ns['_fake_session'].calls), 1)
 
     def test_refused_connection_is_never_retried(self):
@@ -178,13 +181,13 @@ class OktellRetryTests(unittest.TestCase):
             requests.packages.urllib3.exceptions.NewConnectionError(
                 None, "Failed to establish a new connection: [Errno 111] Connection refused"))])
         with self.assertRaises(requests.exceptions.ConnectionError):
-            ns['_oktell_query']("SELECT 1")
+            ns['_oktell_proxy_query']("SELECT 1")
         self.assertEqual(len(ns['_fake_session'].calls), 1)
 
     def test_http_500_is_not_a_retry_reason(self):
         ns = _namespace([_FakeResponse(status_code=500, text='Login timeout expired')])
         with self.assertRaises(RuntimeError):
-            ns['_oktell_query']("SELECT 1")
+            ns['_oktell_proxy_query']("SELECT 1")
         self.assertEqual(len(ns['_fake_session'].calls), 1)
 
 
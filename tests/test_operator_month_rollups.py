@@ -0,0 +1,199 @@
+"""Свёртка «оператор × месяц» для «Учёта часов» (operator_month_rollups).
+
+Раньше каждая загрузка страницы считала видимость оператора EXISTS-сканами по
+daily_hours и членствам, а ставку — коррелированным подзапросом по work_hours.
+Теперь это читается из свёртки, которую обновляют записи. Методы Database
+берутся из database.py через AST и гоняются на записывающем курсоре.
+"""
+
+import ast
+import contextlib
+import logging
+import re
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+from tests import source_cache
+
+
+ROOT = Path(__file__).resolve().parents[1]
+DATABASE_PATH = ROOT / "database.py"
+
+CONSTANTS = ("OPERATOR_MONTH_RATE_SQL", "OPERATOR_MONTH_ROLLUP_RECOMPUTE_SQL")
+METHODS = (
+    "_refresh_operator_month_rollups_tx",
+    "check_operator_month_rollups",
+    "get_daily_hours_for_all_month",
+)
+
+
+class _Cursor:
+    def __init__(self, results=()):
+        self.results = list(results)
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchall(self):
+        return self.results.pop(0) if self.results else []
+
+
+def _database_class():
+    tree = source_cache.parse(source_cache.read(DATABASE_PATH))
+    constants = [
+        node for node in tree.body
+        if isinstance(node, ast.Assign)
+        and any(isinstance(t, ast.Name) and t.id in CONSTANTS for t in node.targets)
+    ]
+    methods = [source_cache.function_node(DATABASE_PATH, name, class_name="Database") for name in METHODS]
+    cls = ast.ClassDef(name="Database", bases=[], keywords=[], body=methods, decorator_list=[])
+    module = ast.Module(body=constants + [cls], type_ignores=[])
+    namespace = {"logging": logging, "datetime": datetime}
+    exec(compile(ast.fix_missing_locations(module), str(DATABASE_PATH), "exec"), namespace)
+    return namespace["Database"]
+
+
+class _FakeDb(_database_class()):
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.ensured = []
+
+    @contextlib.contextmanager
+    def _get_cursor(self):
+        yield self.cursor
+
+    def _ensure_operator_month_rollup_tx(self, cursor, month):
+        self.ensured.append(month)
+
+
+class RefreshTest(unittest.TestCase):
+    def test_empty_selection_costs_no_query(self):
+        cursor = _Cursor()
+        db = _FakeDb(cursor)
+        db._refresh_operator_month_rollups_tx(cursor, operator_ids=[None])
+        db._refresh_operator_month_rollups_tx(cursor, operator_ids=[7], months=[])
+        self.assertEqual([], cursor.executed)
+
+    def test_upsert_is_one_set_based_statement(self):
+        cursor = _Cursor()
+        _FakeDb(cursor)._refresh_operator_month_rollups_tx(
+            cursor, operator_ids={"5", 3, 5}, months=["2026-09", "2026-09"])
+        (sql, params), = cursor.executed
+        self.assertIn("ON CONFLICT (month, operator_id) DO UPDATE", sql)
+        self.assertEqual(
+            {"months": ["2026-09"], "from_month": None, "operator_ids": [3, 5]}, params)
+
+
+class CheckerTest(unittest.TestCase):
+    def _rows(self):
+        return [
+            [("2026-08",), ("2026-09",)],
+            [
+                ("2026-08", 4, True, False, True, True, True, None, None),
+                ("2026-09", 4, True, True, True, True, True, 1, 0.75),
+                ("2026-09", 9, False, None, True, None, False, None, None),
+            ],
+        ]
+
+    def test_reports_drift_against_recompute(self):
+        cursor = _Cursor(self._rows())
+        with self.assertLogs(level="WARNING"):
+            result = _FakeDb(cursor).check_operator_month_rollups(sample_limit=2)
+
+        self.assertEqual(["2026-08", "2026-09"], result["months"])
+        self.assertEqual(3, result["mismatch_count"])
+        self.assertEqual(2, len(result["mismatches"]))
+        self.assertEqual([1.0, 0.75], result["mismatches"][1]["effective_rate"])
+        self.assertFalse(result["repaired"])
+        self.assertEqual(2, len(cursor.executed))
+
+    def test_repair_refreshes_only_drifted_rows_per_month(self):
+        cursor = _Cursor(self._rows())
+        with self.assertLogs(level="WARNING"):
+            result = _FakeDb(cursor).check_operator_month_rollups(month="2026-09", repair=True)
+
+        self.assertTrue(result["repaired"])
+        refreshes = [params for _sql, params in cursor.executed[2:]]
+        self.assertEqual([
+            {"months": ["2026-08"], "from_month": None, "operator_ids": [4]},
+            {"months": ["2026-09"], "from_month": None, "operator_ids": [4, 9]},
+        ], refreshes)
+        self.assertEqual({"months": ["2026-09"]}, cursor.executed[0][1])
+
+    def test_clean_rollup_is_silent(self):
+        cursor = _Cursor([[("2026-09",)], []])
+        result = _FakeDb(cursor).check_operator_month_rollups()
+        self.assertEqual(0, result["mismatch_count"])
+
+
+class ReadPathTest(unittest.TestCase):
+    def test_all_month_reads_visibility_and_rate_from_rollup(self):
+        cursor = _Cursor()
+        db = _FakeDb(cursor)
+        result = db.get_daily_hours_for_all_month("2026-09", department_id=2)
+
+        self.assertEqual([], result["operators"])
+        self.assertEqual(["2026-09"], db.ensured)
+        (sql, params), = cursor.executed
+        self.assertIn("LEFT JOIN operator_month_rollups r", sql)
+        self.assertIn("r.has_daily_hours", sql)
+        self.assertNotIn("FROM daily_hours dh", sql)
+        self.assertEqual(sql.count("%s"), len(params))
+
+    def test_supervisor_month_params_match_placeholders(self):
+        method = ast.get_source_segment(
+            source_cache.read(DATABASE_PATH),
+            source_cache.function_node(DATABASE_PATH, "get_daily_hours_by_supervisor_month", class_name="Database"),
+        )
+        self.assertIn("self._ensure_operator_month_rollup_tx(cursor, month)", method)
+        self.assertEqual(2, method.count("LEFT JOIN operator_month_rollups r"))
+        # Ставка (1) + work_hours (1) + свёртка (1) — три месяца впереди остальных.
+        self.assertIn("(month, month, month, int(group_id), end, start)", method)
+        self.assertIn("(month, month, month, supervisor_id)", method)
+
+
+class WriteHooksTest(unittest.TestCase):
+    def test_writers_keep_the_rollup_current(self):
+        source = source_cache.read(DATABASE_PATH)
+        for name in (
+            "_aggregate_month_from_daily_tx",
+            "insert_or_update_daily_hours",
+            "upsert_daily_calls",
+            "refresh_tez_op_chat_metrics",
+            "add_operator_to_group",
+            "remove_operator_from_group",
+            "archive_group",
+            "reassign_operator_history",
+            "update_group_membership_start_date",
+            "update_user",
+        ):
+            with self.subTest(name=name):
+                method = ast.get_source_segment(
+                    source, source_cache.function_node(DATABASE_PATH, name, class_name="Database"))
+                self.assertRegex(method, r"self\._refresh_operator_month_rollups_tx\(")
+
+    def test_bulk_migrations_drop_built_months(self):
+        source = source_cache.read(DATABASE_PATH)
+        for name in ("_backfill_work_hours_rate_from_history_tx", "_backfill_groups_from_supervisors_tx"):
+            with self.subTest(name=name):
+                method = ast.get_source_segment(
+                    source, source_cache.function_node(DATABASE_PATH, name, class_name="Database"))
+                self.assertIn("self._reset_operator_month_rollups_tx(cursor)", method)
+
+    def test_rollup_recompute_mirrors_the_old_visibility_rule(self):
+        tree = source_cache.parse(source_cache.read(DATABASE_PATH))
+        sql = next(
+            node.value.value for node in tree.body
+            if isinstance(node, ast.Assign)
+            and any(getattr(t, "id", None) == "OPERATOR_MONTH_ROLLUP_RECOMPUTE_SQL" for t in node.targets)
+        )
+        compact = re.sub(r"\s+", " ", sql)
+        self.assertIn("dh.day >= m.start_day AND dh.day <= m.end_day", compact)
+        self.assertIn("gom.start_date <= m.end_day AND (gom.end_date IS NULL OR gom.end_date >= m.start_day)", compact)
+        self.assertIn("wr.month <= m.month ORDER BY wr.month DESC LIMIT 1", compact)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+"""Учёт пула PostgreSQL по потребителям и квоты (pg_pool_metrics.py).
+
+Проверяем настоящий модуль, без базы: квоты — на обычных нитях, учёт выдач —
+через track_checkout напрямую, как его зовёт Database._get_connection.
+"""
+
+import ast
+import logging
+import sys
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+from pathlib import Path
+
+from tests import source_cache
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import pg_pool_metrics  # noqa: E402
+
+DATABASE_PATH = ROOT / "database.py"
+
+
+class ParseBudgetsTest(unittest.TestCase):
+    def test_labels_and_families(self):
+        self.assertEqual(
+            {'route:export_excel': 4, 'job': 10},
+            pg_pool_metrics.parse_budgets(' route:export_excel=4, job=10 ,'),
+        )
+
+    def test_garbage_is_skipped_not_fatal(self):
+        with self.assertLogs(level='WARNING'):
+            budgets = pg_pool_metrics.parse_budgets('job=x,=3,route:a=0,thread:executor=2')
+        self.assertEqual({'thread:executor': 2}, budgets)
+
+
+class BudgetTest(unittest.TestCase):
+    def setUp(self):
+        pg_pool_metrics.configure_budgets({'route:export': 1, 'job': 2})
+        self.addCleanup(pg_pool_metrics.configure_budgets, {})
+
+    def test_exact_label_wins_then_family(self):
+        self.assertEqual('route:export', pg_pool_metrics.budget_label('route:export'))
+        self.assertEqual('job', pg_pool_metrics.budget_label('job:oktell_nightly'))
+        self.assertIsNone(pg_pool_metrics.budget_label('route:login'))
+
+    def test_exhausted_budget_times_out_without_touching_others(self):
+        holding = threading.Event()
+        release = threading.Event()
+
+        def hog():
+            with pg_pool_metrics.acquire_budget('route:export', timeout=1):
+                holding.set()
+                release.wait(2)
+
+        thread = threading.Thread(target=hog)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        self.assertTrue(holding.wait(2))
+
+        with self.assertRaisesRegex(TimeoutError, 'POSTGRES_POOL_BUDGET_TIMEOUT'):
+            with pg_pool_metrics.acquire_budget('route:export', timeout=0.05):
+                pass
+        # Чужой маршрут без квоты проходит сразу.
+        with pg_pool_metrics.acquire_budget('route:login', timeout=0.05):
+            pass
+
+    def test_nested_checkout_does_not_deadlock_on_its_own_budget(self):
+        with pg_pool_metrics.acquire_budget('route:export', timeout=0.05):
+            with pg_pool_metrics.acquire_budget('route:export', timeout=0.05):
+                pass
+
+
+class AcquireDeadlineTest(unittest.TestCase):
+    """Database._get_connection из database.py (через AST) на пуле без соединений."""
+
+    def setUp(self):
+        pg_pool_metrics.configure_budgets({'route:export': 1})
+        self.addCleanup(pg_pool_metrics.configure_budgets, {})
+
+    def _get_connection(self, timeout, semaphore):
+        method = source_cache.function_node(DATABASE_PATH, "_get_connection", "Database")
+        cls = ast.ClassDef(name="Database", bases=[], keywords=[], body=[method], decorator_list=[])
+        namespace = {
+            "contextmanager": contextmanager, "logging": logging, "time": time,
+            "pg_pool_metrics": pg_pool_metrics, "get_pool": lambda: None,
+            "POOL_SEMAPHORE": semaphore, "POOL_ACQUIRE_TIMEOUT_SECONDS": timeout,
+            "POOL_WAIT_WARN_SECONDS": 0, "MAX_CONN": 1,
+        }
+        module = ast.Module(body=[cls], type_ignores=[])
+        exec(compile(ast.fix_missing_locations(module), str(DATABASE_PATH), "exec"), namespace)
+        return namespace["Database"].__dict__["_get_connection"].__get__(object())
+
+    def test_budget_wait_counts_against_the_pool_slot_wait(self):
+        semaphore = threading.BoundedSemaphore(1)
+        semaphore.acquire()
+        self.addCleanup(semaphore.release)
+        get_connection = self._get_connection(0.4, semaphore)
+        holding = threading.Event()
+
+        def hog():
+            with pg_pool_metrics.acquire_budget('route:export', timeout=1):
+                holding.set()
+                time.sleep(0.3)
+
+        thread = threading.Thread(target=hog)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.assertTrue(holding.wait(2))
+
+        started = time.perf_counter()
+        with pg_pool_metrics.consumer('route:export'):
+            with self.assertRaisesRegex(TimeoutError, 'POSTGRES_POOL_ACQUIRE_TIMEOUT'):
+                with get_connection():
+                    pass
+        # Одна отсечка на оба ожидания: ~0.4 с, а не 0.3 + 0.4.
+        self.assertLess(time.perf_counter() - started, 0.6)
+
+
+class TrackingTest(unittest.TestCase):
+    def setUp(self):
+        pg_pool_metrics.reset_stats()
+
+    def _row(self, label):
+        rows = pg_pool_metrics.snapshot()['consumers']
+        return next(row for row in rows if row['consumer'] == label)
+
+    def test_checkout_feeds_consumer_stats_and_request_trace(self):
+        tokens = pg_pool_metrics.set_request_consumer('route:test_trace')
+        try:
+            label = pg_pool_metrics.current_consumer()
+            with pg_pool_metrics.track_checkout(label, waited_seconds=0.25) as checkout:
+                checkout.queries += 3
+                time.sleep(0.01)
+            trace = pg_pool_metrics.request_trace()
+        finally:
+            pg_pool_metrics.end_request(tokens)
+
+        self.assertEqual('route:test_trace', label)
+        self.assertEqual(1, trace['checkouts'])
+        self.assertEqual(3, trace['queries'])
+        self.assertAlmostEqual(250.0, trace['wait_ms'])
+        self.assertGreater(trace['hold_ms'], 0)
+        row = self._row('route:test_trace')
+        self.assertEqual((1, 0, 3), (row['checkouts'], row['in_use'], row['queries']))
+        self.assertEqual(1, row['in_use_peak'])
+        self.assertIsNone(pg_pool_metrics.request_trace())
+
+    def test_unlabelled_work_is_named_after_its_thread_pool(self):
+        seen = []
+        thread = threading.Thread(
+            target=lambda: seen.append(pg_pool_metrics.current_consumer()),
+            name='group-late_2',
+        )
+        thread.start()
+        thread.join()
+        self.assertEqual(['thread:group-late'], seen)
+
+    def test_bind_carries_label_into_executor_thread(self):
+        seen = []
+        fn = pg_pool_metrics.bind('job:nightly', lambda: seen.append(pg_pool_metrics.current_consumer()))
+        thread = threading.Thread(target=fn)
+        thread.start()
+        thread.join()
+        self.assertEqual(['job:nightly'], seen)
+
+    def test_timeouts_are_counted_per_consumer(self):
+        pg_pool_metrics.record_timeout('route:slow')
+        pg_pool_metrics.record_timeout('route:slow', budget=True)
+        row = self._row('route:slow')
+        self.assertEqual((1, 1), (row['timeouts'], row['budget_timeouts']))
+
+
+if __name__ == '__main__':
+    unittest.main()
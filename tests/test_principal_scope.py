@@ -0,0 +1,119 @@
+"""Портрет пользователя для гвардов: отдел и «глава» — без своих походов в базу.
+
+Раньше каждая ручка за «главой отдела», своим отделом и периметром ходила в
+базу отдельными выдачами пула. Теперь портрет приезжает вместе с сессией
+(get_user_session_with_user) и кладётся в g; гварды читают его оттуда.
+
+Функции берутся из bot_schedule2.py через AST (модуль целиком импортировать
+нельзя — он поднимает пул к боевой базе).
+"""
+
+import ast
+import logging
+import re
+import unittest
+from pathlib import Path
+
+from tests import source_cache
+
+
+ROOT = Path(__file__).resolve().parents[1]
+BOT_PATH = ROOT / "bot_schedule2.py"
+DATABASE_PATH = ROOT / "database.py"
+
+FUNCTIONS = (
+    "_principal_scope",
+    "_headed_department_id",
+    "_headed_department_ids",
+    "_user_department_id",
+    "_department_scope_id_for_requester",
+)
+
+
+class _G:
+    pass
+
+
+class _CountingDb:
+    def __init__(self, scopes):
+        self.scopes = scopes
+        self.calls = []
+
+    def get_user_principal_scope(self, user_id):
+        self.calls.append(user_id)
+        return self.scopes.get(user_id)
+
+
+def _namespace(db, g):
+    namespace = {"db": db, "g": g, "logging": logging}
+    nodes = [source_cache.function_node(BOT_PATH, name) for name in FUNCTIONS]
+    exec(compile(ast.Module(body=nodes, type_ignores=[]), str(BOT_PATH), "exec"), namespace)
+    return namespace
+
+
+class PrincipalScopeTest(unittest.TestCase):
+    def test_scope_primed_by_auth_costs_no_queries(self):
+        g = _G()
+        g._principal_scope_cache = {10: {"department_id": 3, "headed_department_ids": (8, 5)}}
+        db = _CountingDb({})
+        ns = _namespace(db, g)
+
+        self.assertEqual(8, ns["_headed_department_id"](10))
+        self.assertEqual(frozenset({5, 8}), ns["_headed_department_ids"](10))
+        self.assertEqual(8, ns["_department_scope_id_for_requester"](10))
+        self.assertEqual(3, ns["_user_department_id"](10))
+        self.assertEqual([], db.calls)
+
+    def test_other_users_are_loaded_once_per_request(self):
+        db = _CountingDb({11: {"department_id": 4, "headed_department_ids": ()}})
+        ns = _namespace(db, _G())
+
+        self.assertIsNone(ns["_headed_department_id"](11))
+        self.assertEqual(4, ns["_department_scope_id_for_requester"](11))
+        self.assertEqual(frozenset(), ns["_headed_department_ids"](11))
+        self.assertEqual([11], db.calls)
+
+    def test_missing_user_and_database_failure_mean_no_scope(self):
+        class _BrokenDb:
+            def get_user_principal_scope(self, user_id):
+                raise TimeoutError("POSTGRES_POOL_ACQUIRE_TIMEOUT")
+
+        ns = _namespace(_CountingDb({}), _G())
+        self.assertIsNone(ns["_department_scope_id_for_requester"](99))
+
+        ns = _namespace(_BrokenDb(), _G())
+        with self.assertLogs(level="ERROR"):
+            self.assertIsNone(ns["_headed_department_id"](12))
+
+
+class SessionQueryTest(unittest.TestCase):
+    """Портрет читается тем же запросом, что сессия, и не ломает кортеж get_user."""
+
+    def test_session_query_carries_scope_and_keeps_user_tuple(self):
+        method = ast.get_source_segment(
+            source_cache.read(DATABASE_PATH),
+            source_cache.function_node(DATABASE_PATH, "get_user_session_with_user", class_name="Database"),
+        )
+        self.assertIn("USER_PRINCIPAL_SCOPE_COLUMNS_SQL", method)
+        self.assertIn('session["principal_scope"]', method)
+        # 13 колонок сессии + 20 колонок пользователя — ровно столько, сколько
+        # отдаёт get_user: позиционные индексы по всему монолиту считают на это.
+        self.assertIn("tuple(row[13:33])", method)
+        get_user = ast.get_source_segment(
+            source_cache.read(DATABASE_PATH),
+            source_cache.function_node(DATABASE_PATH, "get_user", class_name="Database"),
+        )
+        select = re.search(r"SELECT (.*?)\n\s*FROM users u", get_user, re.S).group(1)
+        self.assertEqual(20, len(select.split(",")))
+
+    def test_head_changes_invalidate_the_process_cache(self):
+        source = source_cache.read(DATABASE_PATH)
+        for name in ("set_department_head", "assign_user_department", "update_user"):
+            with self.subTest(name=name):
+                method = ast.get_source_segment(
+                    source, source_cache.function_node(DATABASE_PATH, name, class_name="Database"))
+                self.assertIn("invalidate_user_principal_scope(", method)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+"""Кэш посуточных профилей прогноза (resource_fte/calculations.py).
+
+Курсор — словари в памяти вместо raw_resource_uploads и resource_forecast_cache;
+сам расчёт профиля подменён счётчиком, чтобы видеть, какие дни пересчитаны.
+"""
+
+import json
+import sys
+import unittest
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from unittest import mock
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from resource_fte import calculations  # noqa: E402
+
+SETTINGS = {"answer_rate": 0.95, "occ": 0.7, "ur": 0.95, "fte_rounding": "none", "shrinkage_coeff": 0.9}
+
+
+class _CacheCursor:
+    def __init__(self):
+        self.uploads = {}
+        self.cache = {}
+        self._rows = []
+
+    def execute(self, query, params=None):
+        sql = " ".join(query.split())
+        if sql.startswith("SELECT report_date, updated_at FROM raw_resource_uploads"):
+            wanted = set(params[0])
+            self._rows = [(day, stamp) for day, stamp in self.uploads.items() if day in wanted]
+        elif sql.startswith("SELECT cache_date, history_watermark, payload FROM resource_forecast_cache"):
+            kind, key, dates = params
+            self._rows = [
+                (cache_date, watermark, payload)
+                for (row_kind, cache_date, row_key), (watermark, payload) in self.cache.items()
+                if row_kind == kind and row_key == key and cache_date in dates
+            ]
+        elif sql.startswith("DELETE FROM resource_forecast_cache"):
+            kind, dates, key = params
+            for cache_key in list(self.cache):
+                if cache_key[0] == kind and cache_key[1] in dates and cache_key[2] != key:
+                    del self.cache[cache_key]
+        elif sql.startswith("INSERT INTO resource_forecast_cache"):
+            kind, key, dates, watermarks, payloads = params
+            for cache_date, watermark, payload in zip(dates, watermarks, payloads):
+                self.cache[(kind, cache_date, key)] = (watermark, json.loads(payload))
+        else:
+            raise AssertionError(f"unexpected query: {sql}")
+
+    def fetchall(self):
+        return list(self._rows)
+
+
+class ForecastProfileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cursor = _CacheCursor()
+        self.computed = []
+
+        def _compute(cursor, forecast_date, settings):
+            self.computed.append(forecast_date)
+            return {"forecast_date": forecast_date.isoformat(), "occ": settings["occ"], "avg_daily_calls": 1.5}
+
+        patcher = mock.patch.object(calculations, "_compute_forecast_profile_for_date_tx", side_effect=_compute)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _period(self, settings=SETTINGS):
+        return calculations._compute_period_forecast_profiles_tx(
+            self.cursor, date(2026, 10, 5), date(2026, 10, 11), settings,
+        )
+
+    def test_second_load_is_served_from_cache(self):
+        first = self._period()
+        self.assertEqual(7, len(self.computed))
+        second = self._period()
+        self.assertEqual(7, len(self.computed))
+        self.assertEqual(first, second)
+        self.assertEqual([f"2026-10-{day:02d}" for day in range(5, 12)], [p["forecast_date"] for p in second])
+
+    def test_upload_invalidates_only_days_that_use_it_as_history(self):
+        self._period()
+        self.computed.clear()
+        # 2026-09-21 — история за D-14 для 2026-10-05 и за D-21 для 2026-10-12 (вне периода).
+        self.cursor.uploads[date(2026, 9, 21)] = datetime(2026, 10, 1, 12, 0)
+        self._period()
+        self.assertEqual([date(2026, 10, 5)], self.computed)
+        self.computed.clear()
+        self.cursor.uploads[date(2026, 9, 21)] = datetime(2026, 10, 2, 12, 0)
+        self._period()
+        self.assertEqual([date(2026, 10, 5)], self.computed)
+
+    def test_settings_change_replaces_cached_rows(self):
+        self._period()
+        self.computed.clear()
+        changed = self._period({**SETTINGS, "occ": 0.8})
+        self.assertEqual(7, len(self.computed))
+        self.assertEqual(0.8, changed[0]["occ"])
+        self.assertEqual(7, len(self.cursor.cache))
+
+    def test_settings_hash_ignores_keys_outside_the_profile(self):
+        base = calculations._forecast_profile_settings_hash(SETTINGS)
+        self.assertEqual(base, calculations._forecast_profile_settings_hash({**SETTINGS, "shrinkage_coeff": 0.5}))
+        self.assertNotEqual(base, calculations._forecast_profile_settings_hash({**SETTINGS, "fte_rounding": "ceil"}))
+
+
+class AffectedDatesTest(unittest.TestCase):
+    def test_upload_touches_the_day_and_its_followers(self):
+        day = date(2026, 10, 1)
+        self.assertEqual(
+            [day, day + timedelta(days=14), day + timedelta(days=21)],
+            calculations._forecast_dates_affected_by_history([day]),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
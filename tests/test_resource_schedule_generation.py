@@ -1,11 +1,23 @@
+import random
+import time
 import unittest
+from unittest import mock
 
+from resource_fte import schedule_generation
 from resource_fte.schedule_generation import (
+    _build_shift_preview_candidates,
     _generate_schedule_preview_from_forecast,
+    _normalize_shift_templates,
     _shift_preview_rate_mix_target_counts,
     _run_shift_preview_greedy_strategy,
     _select_best_shift_preview_result,
     _select_default_schedule_preview_variant,
+    _select_shift_preview_strategy,
+    _shift_preview_run_parallel,
+    _shift_preview_run_strategies,
+    _shift_preview_totals,
+    _shift_preview_usage_state,
+    clear_shift_preview_result_cache,
     get_resource_shift_templates,
 )
 
@@ -237,5 +249,214 @@ class ResourceScheduleGenerationTests(unittest.TestCase):
         self.assertTrue(preview["days"][0]["shifts"][0]["excludeFromAuction"])
 
 
+class ShiftPreviewPortfolioTests(unittest.TestCase):
+    def setUp(self):
+        clear_shift_preview_result_cache()
+        self.addCleanup(clear_shift_preview_result_cache)
+
+    def test_parallel_results_keep_the_sequential_order(self):
+        def call(value, delay):
+            return lambda: (time.sleep(delay), value)[1]
+
+        results = _shift_preview_run_parallel([call("cp_sat", 0.05), call("precision", 0.0), call("coverage", 0.02)])
+        self.assertEqual(results, ["cp_sat", "precision", "coverage"])
+
+    @staticmethod
+    def _two_day_problem():
+        rate_capacity = {
+            "1": {"rate": 1.0, "mix_count": 0, "daily_shift_capacity": 2, "weekly_shift_capacity": 6},
+            "0.5": {"rate": 0.5, "mix_count": 0, "daily_shift_capacity": 1, "weekly_shift_capacity": 2},
+        }
+        candidates = _build_shift_preview_candidates(
+            [{}, {}], _normalize_shift_templates(None), rate_capacity, "template", 48,
+        )
+        target = ([0.0] * 7 + [2.0] * 12 + [1.0] * 5) * 2
+        return target, candidates, rate_capacity
+
+    def test_worker_processes_return_what_the_in_process_run_returns(self):
+        target, candidates, rate_capacity = self._two_day_problem()
+        calls = [
+            ("_run_shift_preview_greedy_strategy", (target, candidates, rate_capacity, strategy), {})
+            for strategy in schedule_generation.SHIFT_PREVIEW_GREEDY_STRATEGIES
+        ]
+        with mock.patch.object(schedule_generation, "SHIFT_PREVIEW_PROCESS_WORKERS", 1):
+            expected = _shift_preview_run_strategies(calls)
+        pool = schedule_generation.preview_pool.PreviewProcessPool(schedule_generation.__name__, 2)
+        self.addCleanup(pool.close)
+        self.assertEqual(pool.map(calls), expected)
+
+    def test_worker_exception_reaches_the_caller_and_the_worker_is_reused(self):
+        pool = schedule_generation.preview_pool.PreviewProcessPool(schedule_generation.__name__, 1)
+        self.addCleanup(pool.close)
+        with self.assertRaises(AttributeError):
+            pool.call("_no_such_strategy")
+        worker = pool._idle[0]
+        self.assertEqual(pool.call("_resource_rate_key", (0.5,)), schedule_generation._resource_rate_key(0.5))
+        self.assertIs(pool._idle[0], worker)
+
+    def test_every_cp_sat_seed_runs_in_stage_one(self):
+        target, candidates, rate_capacity = self._two_day_problem()
+        seen = []
+
+        def run_strategies(calls):
+            seen.extend(calls)
+            return [
+                None if name.startswith("_run_shift_preview_cp_sat") else getattr(schedule_generation, name)(*args, **kwargs)
+                for name, args, kwargs in calls
+            ]
+
+        with mock.patch.object(schedule_generation, "_shift_preview_run_strategies", side_effect=run_strategies):
+            schedule_generation._run_shift_preview_strategy_portfolio(target, candidates, rate_capacity)
+        cp_sat_seeds = [kwargs["random_seed"] for name, _args, kwargs in seen if name == "_run_shift_preview_cp_sat_strategy"]
+        self.assertEqual(cp_sat_seeds, list(schedule_generation.SHIFT_PREVIEW_CP_SAT_PORTFOLIO_SEEDS))
+        self.assertIn("_run_shift_preview_cp_sat_fixed_mix_refine_strategy", {name for name, _args, _kwargs in seen})
+
+    def test_concurrent_solves_stay_within_the_search_worker_budget(self):
+        budget = schedule_generation.SHIFT_PREVIEW_CP_SAT_SEARCH_WORKERS
+        for process_workers in (1, 2, 3, 4, budget, budget * 2):
+            with self.subTest(process_workers=process_workers), \
+                    mock.patch.object(schedule_generation, "SHIFT_PREVIEW_PROCESS_WORKERS", process_workers):
+                pool_size = schedule_generation._shift_preview_pool_size()
+                per_solve = schedule_generation._shift_preview_solve_search_workers()
+                self.assertGreaterEqual(per_solve, 1)
+                self.assertLessEqual(pool_size * per_solve, budget)
+        with mock.patch.object(schedule_generation, "SHIFT_PREVIEW_PROCESS_WORKERS", 1):
+            self.assertEqual(schedule_generation._shift_preview_solve_search_workers(), budget)
+
+    def test_pooled_cp_sat_calls_carry_their_share_of_the_budget(self):
+        mapped = []
+
+        class _Pool:
+            def map(self, calls):
+                mapped.extend(calls)
+                return [None] * len(calls)
+
+        calls = [
+            ("_run_shift_preview_cp_sat_strategy", ([], [], {}), {"random_seed": 1}),
+            ("_run_shift_preview_cp_sat_min_over_strategy", ([], [], {}), {}),
+            ("_run_shift_preview_greedy_strategy", ([], [], {}, {}), {}),
+        ]
+        with mock.patch.object(schedule_generation, "SHIFT_PREVIEW_PROCESS_WORKERS", 4), \
+                mock.patch.object(schedule_generation, "_shift_preview_pool", return_value=_Pool()):
+            _shift_preview_run_strategies(calls[1:2])
+            _shift_preview_run_strategies(calls)
+        share = schedule_generation._shift_preview_solve_search_workers()
+        self.assertEqual(len(mapped), 4, "a single solve goes through the pool too")
+        self.assertEqual([kwargs.get("search_workers") for _name, _args, kwargs in mapped], [share, share, share, None])
+
+    def test_reopening_the_same_inputs_is_served_from_the_result_cache(self):
+        template = {"label": "7*16", "rate": 1.0, "startMinute": 420, "endMinute": 960}
+        candidates = [{"dayIndex": 0, "rateKey": "1", "source": "template", "template": template}]
+        rate_capacity = {"1": {"count": 1, "daily_shift_capacity": 1, "weekly_shift_capacity": 1}}
+        solved = {"best": {"method": "greedy", "selected": [{"dayIndex": 0}]}, "strategy_results": []}
+
+        with mock.patch.object(
+            schedule_generation, "_run_shift_preview_strategy_portfolio", return_value=solved,
+        ) as portfolio:
+            first = _select_shift_preview_strategy([1.0] * 24, candidates, rate_capacity)
+            first["best"]["selected"].clear()
+            again = _select_shift_preview_strategy([1.0] * 24, candidates, rate_capacity)
+            self.assertEqual(portfolio.call_count, 1)
+            self.assertEqual(again["best"]["selected"], [{"dayIndex": 0}])
+
+            # Carry-in coverage is part of the key: a different carry-in is a different problem.
+            _select_shift_preview_strategy([1.0] * 24, candidates, rate_capacity, initial_coverage=[1.0] + [0.0] * 23)
+            self.assertEqual(portfolio.call_count, 2)
+
+
+class ShiftPreviewKernelTests(unittest.TestCase):
+    """The batched kernels must reproduce the per-candidate helpers they replace in the hot
+    loops: same feasibility, the same greedy score bits, the same move deltas."""
+
+    def setUp(self):
+        rng = random.Random(20260525)
+        self.total_hours = 48
+        self.rate_capacity = {
+            "1": {"rate": 1.0, "mix_count": 0, "daily_shift_capacity": 1, "weekly_shift_capacity": 5},
+            "0.75": {"rate": 0.75, "mix_count": 0, "daily_shift_capacity": 1, "weekly_shift_capacity": 4},
+            "0.5": {"rate": 0.5, "mix_count": 0, "daily_shift_capacity": 2, "weekly_shift_capacity": 1},
+        }
+        self.candidates = _build_shift_preview_candidates(
+            [{}, {}], _normalize_shift_templates(None), self.rate_capacity, "template", self.total_hours,
+        )
+        self.target = [rng.choice([0.0, 0.5, 1.0, 2.5, 4.0, 6.5]) for _ in range(self.total_hours)]
+        self.coverage = [round(rng.uniform(0.0, 5.0), 4) for _ in range(self.total_hours)]
+        self.selected = [
+            schedule_generation._shift_preview_candidate_to_selected(self.candidates[index])
+            for index in (0, 5, 11, len(self.candidates) - 3)
+        ]
+        self.matrix = schedule_generation._shift_preview_candidate_matrix(
+            self.candidates, self.rate_capacity, self.total_hours,
+        )
+        self.rows = schedule_generation.np.arange(len(self.candidates))
+
+    def _arrays(self):
+        np = schedule_generation.np
+        return np.array(self.target), np.array(self.coverage)
+
+    def test_batch_score_is_bit_identical_to_the_scalar_score(self):
+        target, coverage = self._arrays()
+        for strategy in schedule_generation.SHIFT_PREVIEW_GREEDY_STRATEGIES:
+            batch = schedule_generation._shift_preview_batch_score(target, coverage, self.matrix, self.rows, strategy)
+            for row, candidate in enumerate(self.candidates):
+                expected = schedule_generation._shift_preview_score(
+                    self.target, self.coverage, candidate["vector"], strategy, candidate["activeVector"],
+                )
+                for key, value in expected.items():
+                    self.assertEqual(float(batch[key][row]), value, (strategy["name"], row, key))
+
+    def test_batch_move_delta_matches_add_and_swap_moves(self):
+        np = schedule_generation.np
+        target, coverage = self._arrays()
+        added = schedule_generation._shift_preview_batch_move_delta(
+            target, coverage, self.matrix["window_hours"], self.matrix["window_vector"],
+        )
+        removed_items = self.candidates[7]["activeVector"]
+        removed_vector = np.zeros(self.total_hours)
+        for index, amount in removed_items:
+            removed_vector[index] = amount
+        swapped = schedule_generation._shift_preview_batch_move_delta(
+            target, coverage, np.arange(self.total_hours), self.matrix["vector"] - removed_vector,
+        )
+        for row, candidate in enumerate(self.candidates):
+            for batch, removed in ((added, None), (swapped, removed_items)):
+                expected = schedule_generation._shift_preview_local_move_delta(
+                    self.target, self.coverage, candidate["activeVector"], removed,
+                )
+                self.assertAlmostEqual(float(batch["deficit"][row]), expected["deficit"], places=9)
+                self.assertAlmostEqual(float(batch["over"][row]), expected["over"], places=9)
+
+    def test_batch_feasibility_matches_the_capacity_checks(self):
+        usage_state = _shift_preview_usage_state(self.selected, self.total_hours)
+        usage = schedule_generation._shift_preview_usage_arrays(usage_state, self.matrix)
+        for removed_item in [None] + self.selected:
+            allowed = schedule_generation._shift_preview_batch_can_add(
+                self.matrix, self.rows, usage, removed_item=removed_item,
+            )
+            expected = [
+                schedule_generation._shift_preview_can_add_candidate(
+                    candidate, usage_state, self.rate_capacity, self.total_hours, removed_item=removed_item,
+                )
+                for candidate in self.candidates
+            ]
+            self.assertEqual(allowed.tolist(), expected)
+            self.assertIn(False, expected)
+
+    def test_prune_totals_match_removing_each_shift(self):
+        coverage = list(self.coverage)
+        active_by_item = []
+        for item in self.selected:
+            active_by_item.append(schedule_generation._shift_preview_active_items(item["vector"]))
+            coverage = [round(value + amount, 4) for value, amount in zip(coverage, item["vector"])]
+        batch = schedule_generation._shift_preview_prune_totals(self.target, coverage, active_by_item)
+        for item, totals in zip(self.selected, batch):
+            without = [round(value - amount, 4) for value, amount in zip(coverage, item["vector"])]
+            expected = _shift_preview_totals(self.target, without)
+            self.assertEqual(
+                totals,
+                {key: expected[key] for key in ("deficitFteHours", "overFteHours", "realCoveragePercent")},
+            )
+
+
 if __name__ == "__main__":
     unittest.main()
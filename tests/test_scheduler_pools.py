@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""Исполнение джоб планировщика (scheduler_pools.py): классы, пулы, бюджеты, учёт, перебеги,
+журнал прогонов и тренды длительности.
+
+Пулы настоящие, но маленькие; время прогона — поддельные часы, поэтому
+перебег интервала проверяется без настоящих минут. Журнал пишется в список.
+"""
+
+import ast
+import asyncio
+import math
+import sys
+import threading
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import scheduler_pools  # noqa: E402
+from tests import source_cache  # noqa: E402
+
+BOT_PATH = ROOT / "bot_schedule2.py"
+DATABASE_PATH = ROOT / "database.py"
+
+CLASSES = (
+    ('oktell_*', 'oktell', 'oktell'),
+    ('chat2desk_*', 'chat2desk', 'chat2desk'),
+    ('chat_hourly_broadcast', 'broadcast', 'chat2desk'),
+    ('*_report', 'broadcast', None),
+)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _pools(clock=None, **kwargs):
+    options = dict(pools={'default': 1, 'oktell': 1, 'chat2desk': 1, 'broadcast': 2},
+                   classes=CLASSES, budgets={'chat2desk': 1})
+    options.update(kwargs)
+    if clock is not None:
+        options['clock'] = clock
+    pools = scheduler_pools.SchedulerPools(**options)
+    return pools
+
+
+def _job_row(pools, job_id):
+    return next(row for row in pools.snapshot()['jobs'] if row['job_id'] == job_id)
+
+
+class ClassifyTests(unittest.TestCase):
+    def test_first_matching_pattern_wins(self):
+        pools = _pools()
+        self.assertEqual(pools.classify('oktell_sync_daily'), ('oktell', 'oktell'))
+        self.assertEqual(pools.classify('chat_hourly_broadcast'), ('broadcast', 'chat2desk'))
+        self.assertEqual(pools.classify('weekly_report'), ('broadcast', None))
+        self.assertEqual(pools.classify('monthly_auto_fill_norm'), ('default', None))
+
+    def test_unknown_pool_is_rejected(self):
+        with self.assertRaises(ValueError):
+            scheduler_pools.SchedulerPools({'default': 1}, [('x_*', 'missing', None)])
+
+
+class RoutingTests(unittest.TestCase):
+    def setUp(self):
+        self.pools = _pools()
+        self.fallback = scheduler_pools.concurrent.futures.ThreadPoolExecutor(
+            1, thread_name_prefix='executor')
+        self.executor = scheduler_pools.JobAwareExecutor(self.pools, self.fallback)
+        self.addCleanup(self.executor.shutdown)
+
+    def test_steps_of_a_job_go_to_its_pool_and_the_rest_to_the_old_one(self):
+        executor = self.executor
+
+        async def oktell_job():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, lambda: threading.current_thread().name)
+
+        async def scenario():
+            job = self.pools.instrument('oktell_sync_daily', oktell_job)
+            inside = await job()
+            outside = await asyncio.get_running_loop().run_in_executor(
+                executor, lambda: threading.current_thread().name)
+            return inside, outside
+
+        inside, outside = asyncio.run(scenario())
+        self.assertTrue(inside.startswith('job-oktell'), inside)
+        self.assertTrue(outside.startswith('executor'), outside)
+        row = _job_row(self.pools, 'oktell_sync_daily')
+        self.assertEqual((row['runs'], row['steps'], row['queued'], row['running']), (1, 1, 0, 0))
+
+    def test_sync_job_runs_in_its_pool_not_in_the_loop(self):
+        def sync_job():
+            return threading.current_thread().name
+
+        name = asyncio.run(self.pools.instrument('weekly_report', sync_job)())
+        self.assertTrue(name.startswith('job-broadcast'), name)
+
+    def test_step_is_labelled_for_the_db_pool_accounting(self):
+        import pg_pool_metrics
+
+        seen = self.pools.submit(self.pools.spec('oktell_sync_daily'),
+                                 pg_pool_metrics.current_consumer).result()
+        self.assertEqual(seen, 'job:oktell_sync_daily')
+
+
+class BudgetTests(unittest.TestCase):
+    def test_system_budget_spans_pools(self):
+        pools = _pools()
+        self.addCleanup(pools.shutdown)
+        active, peak, lock = [0], [0], threading.Lock()
+        release = threading.Event()
+
+        def step():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            release.wait(0.2)
+            with lock:
+                active[0] -= 1
+
+        futures = [pools.submit(pools.spec('chat2desk_metrics_sync'), step),
+                   pools.submit(pools.spec('chat_hourly_broadcast'), step),
+                   pools.submit(pools.spec('chat_hourly_broadcast'), step)]
+        for future in futures:
+            future.result(timeout=5)
+        # Три шага из двух пулов, но в Chat2Desk — по одному.
+        self.assertEqual(peak[0], 1)
+
+
+class OverrunTests(unittest.TestCase):
+    def test_run_longer_than_interval_is_an_overrun(self):
+        clock = _Clock()
+        pools = _pools(clock=clock)
+
+        async def slow():
+            clock.now += 130
+
+        async def fast():
+            clock.now += 10
+
+        trigger = CronTrigger(minute='*/2')
+        with self.assertLogs(level='WARNING') as logs:
+            asyncio.run(pools.instrument('oktell_sync_daily', slow, trigger)())
+        asyncio.run(pools.instrument('oktell_sync_daily', fast, trigger)())
+        row = _job_row(pools, 'oktell_sync_daily')
+        self.assertEqual((row['runs'], row['overruns']), (2, 1))
+        self.assertEqual(row['interval_seconds'], 120)
+        self.assertEqual((row['max_seconds'], row['avg_seconds']), (130, 70))
+        self.assertIn('oktell_sync_daily', logs.output[0])
+
+    def test_failures_are_counted_and_reraised(self):
+        pools = _pools()
+
+        async def broken():
+            raise RuntimeError('proxy down')
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(pools.instrument('oktell_sync_daily', broken)())
+        row = _job_row(pools, 'oktell_sync_daily')
+        self.assertEqual(row['failures'], 1)
+        self.assertEqual(row['last_error'], 'RuntimeError: proxy down')
+
+    def test_trigger_interval(self):
+        now = datetime(2026, 10, 1, 12, 0)
+        self.assertEqual(scheduler_pools.trigger_interval_seconds(
+            CronTrigger(minute='*/2', timezone='UTC'), now), 120)
+        self.assertEqual(scheduler_pools.trigger_interval_seconds(
+            IntervalTrigger(minutes=15, timezone='UTC')), 900)
+        self.assertIsNone(scheduler_pools.trigger_interval_seconds(
+            DateTrigger(datetime(2026, 10, 1, 13, 0), timezone='UTC'), now))
+
+
+class ProcessPoolTests(unittest.TestCase):
+    def test_process_pool_runs_picklable_functions(self):
+        pools = scheduler_pools.SchedulerPools({'default': 1, 'cpu': ('process', 1)},
+                                               [('heavy_*', 'cpu', None)])
+        self.addCleanup(pools.shutdown)
+        spec = pools.spec('heavy_rollup')
+        self.assertTrue(pools.is_process_pool('cpu'))
+        self.assertEqual(pools.submit(spec, math.factorial, 10).result(timeout=60), 3628800)
+        self.assertEqual(pools.snapshot()['pools']['cpu'], {'size': 'process:1', 'queued': 0})
+
+
+class SnapshotTests(unittest.TestCase):
+    def test_reset_keeps_running_state(self):
+        pools = _pools()
+
+        async def job():
+            return None
+
+        asyncio.run(pools.instrument('weekly_report', job)())
+        pools.reset_stats()
+        row = _job_row(pools, 'weekly_report')
+        self.assertEqual((row['runs'], row['pool'], row['running']), (0, 'broadcast', 0))
+        self.assertEqual(pools.snapshot()['budgets'], {'chat2desk': 1})
+
+
+class _Journal(list):
+    def __init__(self):
+        super().__init__()
+        self.written = threading.Event()
+
+    def __call__(self, record):
+        self.append(record)
+        self.written.set()
+
+
+def _journaled(pools, job_id, func, trigger=None):
+    journal = _Journal()
+    pools.journal = journal
+    try:
+        asyncio.run(pools.instrument(job_id, func, trigger)())
+    except RuntimeError:
+        pass
+    journal.written.wait(5)
+    pools.shutdown()
+    return journal
+
+
+class JournalTests(unittest.TestCase):
+    def test_run_is_recorded_with_counters(self):
+        clock = _Clock()
+        pools = _pools(clock=clock)
+        executor = scheduler_pools.JobAwareExecutor(
+            pools, scheduler_pools.concurrent.futures.ThreadPoolExecutor(1))
+        self.addCleanup(executor.shutdown)
+
+        def fetch():
+            # Шаг в нити пула: вызовы внешней системы засчитываются прогону.
+            scheduler_pools.count_external_call()
+            scheduler_pools.count_external_call()
+            return 40
+
+        async def job():
+            rows = await asyncio.get_running_loop().run_in_executor(executor, fetch)
+            scheduler_pools.count_rows(rows)
+            scheduler_pools.count_rows(2)
+            clock.now += 3
+
+        [record] = _journaled(pools, 'oktell_sync_daily', job, CronTrigger(minute='*/2'))
+        self.assertEqual(record['job_id'], 'oktell_sync_daily')
+        self.assertEqual(record['pool'], 'oktell')
+        self.assertTrue(record['ok'])
+        self.assertEqual(record['duration_ms'], 3000)
+        self.assertEqual(record['rows_processed'], 42)
+        self.assertEqual(record['external_calls'], 2)
+        self.assertEqual(record['interval_seconds'], 120)
+        self.assertLessEqual(record['started_at'], record['finished_at'])
+        self.assertIsNone(record['error'])
+
+    def test_rows_and_failure_from_the_sync_result(self):
+        async def ok():
+            return {'status': 'success', 'oktell_rows': 1200, 'pages': 3}
+
+        async def failed():
+            return {'status': 'failed', 'error': 'proxy timeout'}
+
+        [record] = _journaled(_pools(), 'oktell_sync_daily', ok)
+        self.assertEqual((record['ok'], record['rows_processed']), (True, 1200))
+        [record] = _journaled(_pools(), 'oktell_sync_daily', failed)
+        self.assertEqual((record['ok'], record['error']), (False, 'proxy timeout'))
+
+    def test_exception_is_recorded(self):
+        async def broken():
+            raise RuntimeError('proxy down')
+
+        [record] = _journaled(_pools(), 'oktell_sync_daily', broken)
+        self.assertFalse(record['ok'])
+        self.assertEqual(record['error'], 'RuntimeError: proxy down')
+
+    def test_broken_journal_does_not_fail_the_job(self):
+        pools = _pools()
+
+        def journal(record):
+            raise RuntimeError('db down')
+
+        async def job():
+            return 'done'
+
+        pools.journal = journal
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(asyncio.run(pools.instrument('weekly_report', job)()), 'done')
+            pools.shutdown()
+
+    def test_counters_outside_a_job_are_ignored(self):
+        scheduler_pools.count_rows(5)
+        scheduler_pools.count_external_call()
+
+    def test_http_requests_count_as_external_calls(self):
+        import http_clients
+
+        pools = _pools()
+        shared = http_clients.integration('test:scheduler-journal')
+
+        async def job():
+            shared.observe(0.1, status=200)
+
+        [record] = _journaled(pools, 'chatapp_sync_daily', job)
+        self.assertEqual(record['external_calls'], 1)
+
+
+class OverlapAlertTests(unittest.TestCase):
+    def test_thresholds(self):
+        self.assertIsNone(scheduler_pools.overlap_alert(50, 120))
+        self.assertEqual(scheduler_pools.overlap_alert(100, 120), 'near')
+        self.assertEqual(scheduler_pools.overlap_alert(130, 120), 'overrun')
+        self.assertIsNone(scheduler_pools.overlap_alert(130, None))
+
+    def test_creeping_job_is_flagged_once(self):
+        clock = _Clock()
+        pools = _pools(clock=clock)
+        trigger = CronTrigger(minute='*/2')
+
+        def run(seconds):
+            async def job():
+                clock.now += seconds
+            asyncio.run(pools.instrument('group_late_poll', job, trigger)())
+
+        run(30)
+        with self.assertLogs(level='WARNING') as logs:
+            run(100)
+            run(100)
+        # Предупреждение — на переход в «near», а не на каждый прогон.
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('group_late_poll', logs.output[0])
+        row = _job_row(pools, 'group_late_poll')
+        self.assertEqual((row['alert'], row['p95_seconds'], row['p50_seconds']), ('near', 100, 100))
+
+    def test_trend_report_ranks_jobs_by_interval_share(self):
+        buckets = [
+            {'job_id': 'group_late_poll', 'bucket': '2026-10-01', 'runs': 720, 'failures': 0,
+             'p50_ms': 40000, 'p95_ms': 60000, 'interval_seconds': 120},
+            {'job_id': 'group_late_poll', 'bucket': '2026-10-02', 'runs': 720, 'failures': 2,
+             'p50_ms': 70000, 'p95_ms': 102000, 'interval_seconds': 120},
+            {'job_id': 'weekly_report', 'bucket': '2026-10-01', 'runs': 1, 'failures': 0,
+             'p50_ms': 9000, 'p95_ms': 9000, 'interval_seconds': 604800},
+        ]
+        report = scheduler_pools.trend_report(buckets)
+        self.assertEqual([job['job_id'] for job in report], ['group_late_poll', 'weekly_report'])
+        top = report[0]
+        self.assertEqual((top['runs'], top['failures']), (1440, 2))
+        self.assertEqual((top['p95_seconds'], top['interval_share']), (102, 0.85))
+        self.assertEqual((top['p95_growth'], top['alert']), (1.7, 'near'))
+        self.assertIsNone(report[1]['alert'])
+
+
+class JournalSchemaTests(unittest.TestCase):
+    DATABASE = source_cache.read(DATABASE_PATH)
+
+    def test_table_and_percentiles(self):
+        self.assertIn("CREATE TABLE IF NOT EXISTS scheduler_job_runs", self.DATABASE)
+        trends = ast.get_source_segment(self.DATABASE, source_cache.function_node(
+            DATABASE_PATH, "get_scheduler_job_run_trends", "Database"))
+        self.assertIn("percentile_cont(0.95) WITHIN GROUP (ORDER BY duration_ms)", trends)
+        record = ast.get_source_segment(self.DATABASE, source_cache.function_node(
+            DATABASE_PATH, "record_scheduler_job_run", "Database"))
+        self.assertIn("DELETE FROM scheduler_job_runs", record)
+
+
+class WiringTests(unittest.TestCase):
+    SOURCE = source_cache.read(BOT_PATH)
+
+    def test_every_job_is_instrumented_before_start(self):
+        wrap = self.SOURCE.index("scheduler_job_pools.instrument(")
+        self.assertLess(wrap, self.SOURCE.index("    scheduler.start()"))
+        self.assertIn("executor_pool = scheduler_pools.JobAwareExecutor(", self.SOURCE)
+        self.assertIn("journal=db.record_scheduler_job_run", self.SOURCE)
+
+    def test_every_job_has_an_id(self):
+        main = self.SOURCE[self.SOURCE.index("    scheduler = AsyncIOScheduler()"):
+                           self.SOURCE.index("    scheduler.start()")]
+        calls = main.split("scheduler.add_job(")[1:]
+        self.assertTrue(calls)
+        for call in calls:
+            head = call.split("\n    )", 1)[0]
+            self.assertIn("id=", head, head[:120])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Общий кэш процессов (shared_cache): подписанные ссылки аватаров и схема таблицы.
+
+Процессов waitress может быть несколько. Ссылки, подписанные разными процессами,
+различаются, и браузер перекачивает одну и ту же картинку, — поэтому процессы
+сходятся на одной ссылке через таблицу в базе. Сама база заменена словарём.
+"""
+
+import ast
+import logging
+import threading
+import time
+import unittest
+from datetime import timedelta
+from pathlib import Path
+
+from tests import source_cache
+
+ROOT = Path(__file__).resolve().parents[1]
+BOT_PATH = ROOT / "bot_schedule2.py"
+DATABASE_PATH = ROOT / "database.py"
+
+AVATAR_NAMES = (
+    "_shared_cache_read",
+    "_shared_cache_write",
+    "_build_avatar_signed_url",
+    "_remember_avatar_signed_url",
+)
+
+
+class _SharedTable:
+    """Таблица shared_cache: ключ -> (value, expires_at), с охраной keep_remaining."""
+
+    def __init__(self):
+        self.rows = {}
+        self.puts = 0
+
+    def shared_cache_get(self, key):
+        value, expires_at = self.rows.get(key, (None, None))
+        if expires_at is None or expires_at <= time.time():
+            return None, None
+        return value, expires_at
+
+    def shared_cache_put(self, key, value, ttl_seconds, keep_remaining_seconds=None):
+        self.puts += 1
+        current = self.rows.get(key)
+        if (current is not None and keep_remaining_seconds is not None
+                and current[1] > time.time() + keep_remaining_seconds):
+            return current
+        self.rows[key] = (value, time.time() + ttl_seconds)
+        return self.rows[key]
+
+
+class _Signer:
+    """Поддельный GCS: каждая подпись — новая ссылка, как у настоящего (X-Goog-Date)."""
+
+    def __init__(self):
+        self.signed = 0
+
+    def bucket(self, bucket_name):
+        return self
+
+    def blob(self, blob_path):
+        return self
+
+    def generate_signed_url(self, **_kwargs):
+        self.signed += 1
+        return f"https://storage.example/avatar?sig={self.signed}"
+
+
+def _process(table, signer, enabled=True):
+    """Namespace одного «процесса»: свой кэш в памяти, общая таблица."""
+    functions = [
+        source_cache.function_node(BOT_PATH, name) for name in AVATAR_NAMES
+    ]
+    namespace = {
+        "time": time,
+        "timedelta": timedelta,
+        "logging": logging,
+        "db": table,
+        "get_gcs_client": lambda: signer,
+        "SHARED_CACHE_ENABLED": enabled,
+        "AVATAR_SIGNED_URL_TTL_SECONDS": 3600,
+        "AVATAR_SIGNED_URL_CACHE_MAX_ITEMS": 100,
+        "AVATAR_SIGNED_URL_CACHE_MIN_REMAINING_SECONDS": 60,
+        "AVATAR_SIGNED_URL_CACHE": {},
+        "AVATAR_SIGNED_URL_CACHE_LOCK": threading.Lock(),
+    }
+    exec(compile(ast.Module(body=functions, type_ignores=[]), str(BOT_PATH), "exec"), namespace)
+    return namespace
+
+
+class AvatarSignedUrlSharedCacheTests(unittest.TestCase):
+    def test_processes_hand_out_the_same_url(self):
+        table, signer = _SharedTable(), _Signer()
+        first, second = _process(table, signer), _process(table, signer)
+
+        url = first["_build_avatar_signed_url"]("bucket", "a.webp")
+        self.assertEqual(url, second["_build_avatar_signed_url"]("bucket", "a.webp"))
+        self.assertEqual(1, signer.signed)
+        # Дальше — из памяти процесса, без базы.
+        puts = table.puts
+        self.assertEqual(url, second["_build_avatar_signed_url"]("bucket", "a.webp"))
+        self.assertEqual(puts, table.puts)
+
+    def test_simultaneous_misses_converge_on_the_first_url(self):
+        table, signer = _SharedTable(), _Signer()
+        first, second = _process(table, signer), _process(table, signer)
+        # Оба промахнулись до того, как кто-то записал: второй подписал свою, но
+        # запись соседа свежая и не перетирается — отдаётся она.
+        second["_shared_cache_read"] = lambda key: None
+
+        url = first["_build_avatar_signed_url"]("bucket", "a.webp")
+        self.assertEqual(url, second["_build_avatar_signed_url"]("bucket", "a.webp"))
+        self.assertEqual(2, signer.signed)
+
+    def test_broken_shared_tier_falls_back_to_signing(self):
+        class Broken:
+            def shared_cache_get(self, key):
+                raise RuntimeError('relation "shared_cache" does not exist')
+
+            shared_cache_put = shared_cache_get
+
+        signer = _Signer()
+        process = _process(Broken(), signer)
+        self.assertTrue(process["_build_avatar_signed_url"]("bucket", "a.webp"))
+        disabled = _process(_SharedTable(), signer, enabled=False)
+        self.assertTrue(disabled["_build_avatar_signed_url"]("bucket", "b.webp"))
+        self.assertEqual(2, signer.signed)
+
+
+class SharedCacheSchemaTests(unittest.TestCase):
+    DATABASE = source_cache.read(DATABASE_PATH)
+
+    def test_table_is_unlogged(self):
+        self.assertIn("CREATE UNLOGGED TABLE IF NOT EXISTS shared_cache", self.DATABASE)
+
+    def test_put_keeps_a_fresh_neighbour_value(self):
+        put = ast.get_source_segment(
+            self.DATABASE, source_cache.function_node(DATABASE_PATH, "shared_cache_put", "Database"))
+        self.assertIn("ON CONFLICT (cache_key) DO UPDATE", put)
+        self.assertIn("WHERE shared_cache.expires_at <= NOW() + %s * INTERVAL '1 second'", put)
+        self.assertIn("DELETE FROM shared_cache WHERE expires_at < NOW()", put)
+
+
+if __name__ == "__main__":
+    unittest.main()
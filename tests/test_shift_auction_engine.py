@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""Движок захватов аукциона (shift_auction_engine.py): пачки, повторы, память лотов.
+
+База заменена функциями над словарём лотов, буфер событий — списком.
+"""
+
+import sys
+import unittest
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import shift_auction_engine  # noqa: E402
+
+LOT_EVENTS = {"lot_claimed", "lot_released", "lot_added"}
+
+
+class _FakeAuction:
+    def __init__(self, lots):
+        self.lots = dict(lots)
+        self.events = []
+        self.batches = []
+        self.singles = []
+        self.loads = 0
+        self.fail_batch = False
+        self.buffer_ready = True
+
+    def _event(self, event_type, lot_id):
+        event = {
+            "id": len(self.events) + 1,
+            "event_type": event_type,
+            "payload": {"lot": {"id": lot_id, "status": self.lots.get(lot_id)}},
+        }
+        self.events.append(event)
+        return event
+
+    def apply(self, action, operator_id, lot_id):
+        if action == "release":
+            self.lots[lot_id] = "available"
+            return {"lot": {"id": lot_id, "status": "available"}, "event": self._event("lot_released", lot_id)}
+        if self.lots.get(lot_id) != "available":
+            raise ValueError("LOT_ALREADY_CLAIMED")
+        self.lots[lot_id] = "claimed"
+        return {"lot": {"id": lot_id, "status": "claimed"}, "event": self._event("lot_claimed", lot_id)}
+
+    def process_batch(self, requests):
+        self.batches.append(list(requests))
+        if self.fail_batch:
+            raise RuntimeError("connection lost")
+        outcomes = []
+        for request in requests:
+            try:
+                outcomes.append(self.apply(*request))
+            except Exception as error:
+                outcomes.append(error)
+        return outcomes
+
+    def process_one(self, *request):
+        self.singles.append(request)
+        return self.apply(*request)
+
+    def load(self):
+        self.loads += 1
+        return (self.events[-1]["id"] if self.events else 0), dict(self.lots)
+
+    def read(self, after_id):
+        if not self.buffer_ready:
+            return None
+        return [event for event in self.events if event["id"] > after_id]
+
+
+def _engine(auction, **kwargs):
+    return shift_auction_engine.ShiftAuctionClaimEngine(
+        process_batch=auction.process_batch,
+        process_one=auction.process_one,
+        load_lot_states=auction.load,
+        read_events=auction.read,
+        lot_event_types=LOT_EVENTS,
+        **kwargs,
+    )
+
+
+class ClaimEngineTests(unittest.TestCase):
+    def test_claimed_lot_is_rejected_from_memory(self):
+        auction = _FakeAuction({1: "available", 2: "claimed"})
+        engine = _engine(auction)
+
+        with self.assertRaisesRegex(ValueError, "LOT_ALREADY_CLAIMED"):
+            engine.submit("claim", 7, 2)
+        self.assertEqual([], auction.batches)
+
+        result = engine.submit("claim", 7, 1)
+        self.assertEqual("claimed", result["lot"]["status"])
+        self.assertIn("queue", result["_timings"])
+        with self.assertRaisesRegex(ValueError, "LOT_ALREADY_CLAIMED"):
+            engine.submit("claim", 8, 1)
+        self.assertEqual(1, len(auction.batches))
+        self.assertEqual(2, engine.snapshot()["fast_rejects"])
+
+    def test_release_seen_in_the_buffer_reopens_the_lot(self):
+        auction = _FakeAuction({1: "claimed"})
+        engine = _engine(auction)
+        self.assertTrue(engine.is_known_claimed(1))
+
+        # Отказ провёл другой процесс — сюда он приходит только событием.
+        auction.lots[1] = "available"
+        auction._event("lot_released", 1)
+        self.assertFalse(engine.is_known_claimed(1))
+        self.assertEqual("claimed", engine.submit("claim", 7, 1)["lot"]["status"])
+
+    def test_release_with_lower_id_committed_after_the_load_is_replayed(self):
+        auction = _FakeAuction({1: "claimed", 2: "available"})
+        # Отказ от лота 1 получил id 1, но ещё не зафиксирован; захват лота 2 (id 2)
+        # уже виден. Загрузка отдаёт устоявшуюся версию 0, а не MAX(id) = 2.
+        release = {"id": 1, "event_type": "lot_released", "payload": {"lot": {"id": 1, "status": "available"}}}
+        claim = {"id": 2, "event_type": "lot_claimed", "payload": {"lot": {"id": 2, "status": "claimed"}}}
+        auction.lots[2] = "claimed"
+        auction.load = lambda: (0, dict(auction.lots))
+        engine = _engine(auction)
+        self.assertTrue(engine.is_known_claimed(1))
+
+        auction.lots[1] = "available"
+        auction.events.extend([release, claim])
+        self.assertFalse(engine.is_known_claimed(1))
+        self.assertTrue(engine.is_known_claimed(2))
+        self.assertEqual("claimed", engine.submit("claim", 7, 1)["lot"]["status"])
+
+    def test_structural_event_forces_a_reload(self):
+        auction = _FakeAuction({1: "claimed"})
+        engine = _engine(auction)
+        engine.is_known_claimed(1)
+        auction.lots = {1: "available"}
+        auction.events.append({"id": len(auction.events) + 1, "event_type": "lots_seeded", "payload": {}})
+
+        self.assertFalse(engine.is_known_claimed(1))
+        self.assertEqual(2, auction.loads)
+
+    def test_unready_buffer_disables_the_memory_path(self):
+        auction = _FakeAuction({1: "claimed"})
+        auction.buffer_ready = False
+        engine = _engine(auction)
+
+        with self.assertRaisesRegex(ValueError, "LOT_ALREADY_CLAIMED"):
+            engine.submit("claim", 7, 1)
+        self.assertEqual(1, len(auction.batches))
+
+    def test_failed_batch_is_retried_one_by_one(self):
+        auction = _FakeAuction({1: "available"})
+        auction.fail_batch = True
+        engine = _engine(auction)
+
+        self.assertEqual("claimed", engine.submit("claim", 7, 1)["lot"]["status"])
+        self.assertEqual([("claim", 7, 1)], auction.singles)
+        self.assertEqual(1, engine.snapshot()["batch_failures"])
+
+    def test_queued_job_times_out_as_busy(self):
+        auction = _FakeAuction({1: "available"})
+        engine = _engine(auction, timeout_seconds=0.05)
+        # Писатели «заняты»: никто не разбирает очередь.
+        engine._writers_started = True
+
+        with self.assertRaises(shift_auction_engine.ShiftAuctionEngineBusy):
+            engine.submit("claim", 7, 1)
+        self.assertEqual("available", auction.lots[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
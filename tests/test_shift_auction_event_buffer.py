@@ -1,6 +1,7 @@
 import ast
 import collections
 import threading
+import time
 import unittest
 from pathlib import Path
 from tests import source_cache
@@ -12,6 +13,8 @@ HELPERS = {
     "_read_shift_auction_events_from_buffer",
     "_drain_shift_auction_events",
     "_initialize_shift_auction_event_buffer",
+    "_contiguous_shift_auction_events",
+    "_settle_shift_auction_event_gap",
 }
 
 
@@ -24,6 +27,9 @@ def _buffer_namespace(maxlen=3, fetch_limit=2):
     namespace = {
         "SHIFT_AUCTION_EVENT_BUFFER_MAXLEN": maxlen,
         "SHIFT_AUCTION_EVENT_FETCH_LIMIT": fetch_limit,
+        "SHIFT_AUCTION_EVENT_GAP_POLL_SECONDS": 0,
+        "shift_auction_event_gap": None,
+        "time": time,
         "shift_auction_event_condition": threading.Condition(),
         "shift_auction_event_signal_id": 0,
         "shift_auction_event_buffer": collections.deque(maxlen=maxlen),
@@ -41,6 +47,20 @@ def _events(start, end):
     ]
 
 
+class _SnapshotCursor:
+    """Отвечает на запрос xmin/xmax снимка транзакций."""
+
+    def __init__(self, xmin, xmax):
+        self.xmin = xmin
+        self.xmax = xmax
+
+    def execute(self, sql, params=None):
+        assert "txid_current_snapshot" in sql
+
+    def fetchone(self):
+        return self.xmin, self.xmax
+
+
 class ShiftAuctionEventBufferTests(unittest.TestCase):
     def test_recent_cursor_reads_from_memory_and_old_cursor_requires_catchup(self):
         namespace = _buffer_namespace()
@@ -75,6 +95,84 @@ class ShiftAuctionEventBufferTests(unittest.TestCase):
             [3, 4, 5],
         )
 
+    def _gap_namespace(self, visible):
+        namespace = _buffer_namespace(maxlen=10, fetch_limit=10)
+        namespace["_fetch_shift_auction_events_with_cursor"] = (
+            lambda _cursor, after_id, limit=10: [event for event in visible if event["id"] > after_id][:limit]
+        )
+        namespace["_publish_shift_auction_events"](_events(1, 2))
+        return namespace
+
+    def _buffered_ids(self, namespace):
+        return [event["id"] for event in namespace["shift_auction_event_buffer"]]
+
+    def test_late_commit_is_published_in_order(self):
+        visible = _events(1, 2) + _events(4, 4)
+        namespace = self._gap_namespace(visible)
+        cursor = _SnapshotCursor(xmin=5, xmax=10)
+
+        namespace["_drain_shift_auction_events"](cursor)
+        self.assertEqual([1, 2], self._buffered_ids(namespace), "id 3 ещё может закоммититься")
+        namespace["_drain_shift_auction_events"](cursor)
+        self.assertEqual([1, 2], self._buffered_ids(namespace))
+
+        visible[2:2] = _events(3, 3)
+        namespace["_drain_shift_auction_events"](cursor)
+        self.assertEqual([1, 2, 3, 4], self._buffered_ids(namespace))
+        namespace["_drain_shift_auction_events"](cursor)
+        self.assertIsNone(namespace["shift_auction_event_gap"])
+
+    def test_rolled_back_id_is_skipped_once_settled(self):
+        namespace = self._gap_namespace(_events(1, 2) + _events(4, 5))
+        cursor = _SnapshotCursor(xmin=5, xmax=10)
+
+        namespace["_drain_shift_auction_events"](cursor)
+        self.assertEqual([1, 2], self._buffered_ids(namespace))
+
+        # Все транзакции, что шли при обнаружении разрыва, завершились.
+        cursor.xmin = 10
+        namespace["_drain_shift_auction_events"](cursor)
+        self.assertEqual([1, 2, 4, 5], self._buffered_ids(namespace))
+
+    def test_gap_settles_while_new_events_keep_arriving(self):
+        visible = _events(1, 2) + _events(4, 4)
+        namespace = self._gap_namespace(visible)
+        cursor = _SnapshotCursor(xmin=5, xmax=10)
+
+        namespace["_drain_shift_auction_events"](cursor)
+        self.assertEqual(10, namespace["shift_auction_event_gap"]["horizon"])
+        # Поток взятий не стихает: каждый опрос видит новое событие и новый xmax,
+        # но горизонт разрыва остаётся тем, что был при его обнаружении.
+        for event_id in range(5, 9):
+            visible.extend(_events(event_id, event_id))
+            cursor.xmin, cursor.xmax = cursor.xmin + 1, cursor.xmax + 1
+            namespace["_drain_shift_auction_events"](cursor)
+            self.assertEqual(10, namespace["shift_auction_event_gap"]["horizon"])
+            self.assertEqual([1, 2], self._buffered_ids(namespace))
+
+        visible.extend(_events(9, 9))
+        cursor.xmin, cursor.xmax = 10, 15
+        namespace["_drain_shift_auction_events"](cursor)
+        self.assertEqual([1, 2, 4, 5, 6, 7, 8, 9], self._buffered_ids(namespace))
+
+    def test_next_gap_after_a_settled_one_waits_for_its_own_horizon(self):
+        visible = _events(1, 2) + _events(4, 5)
+        namespace = self._gap_namespace(visible)
+        cursor = _SnapshotCursor(xmin=5, xmax=10)
+        namespace["_drain_shift_auction_events"](cursor)
+
+        # 7 выдан уже после обнаружения разрыва у 3: горизонт 10 за 6 не ручается.
+        visible.extend(_events(7, 7))
+        cursor.xmin, cursor.xmax = 10, 12
+        namespace["_drain_shift_auction_events"](cursor)
+        self.assertEqual([1, 2, 4, 5], self._buffered_ids(namespace))
+        self.assertEqual((6, 12), (namespace["shift_auction_event_gap"]["missing"],
+                                   namespace["shift_auction_event_gap"]["horizon"]))
+
+        cursor.xmin = 12
+        namespace["_drain_shift_auction_events"](cursor)
+        self.assertEqual([1, 2, 4, 5, 7], self._buffered_ids(namespace))
+
     def test_empty_warmup_marks_buffer_ready_and_wakes_streams(self):
         namespace = _buffer_namespace()
         namespace["_fetch_recent_shift_auction_events_with_cursor"] = lambda _cursor: []
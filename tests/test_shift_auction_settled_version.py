@@ -0,0 +1,172 @@
+"""Версия снимка аукциона — устоявшийся id события, а не MAX(id).
+
+id событий выдаёт nextval до фиксации, поэтому 103 может стать видимым позже 104.
+Модель ниже воспроизводит то, что делают _insert_shift_auction_test_event и
+SHIFT_AUCTION_SETTLED_VERSION_SQL, на xid-ах и снимках как у Postgres; второй
+набор проверок держит сам database.py в рамках этого протокола.
+"""
+
+import ast
+import re
+import unittest
+from pathlib import Path
+
+from tests import source_cache
+
+
+ROOT = Path(__file__).resolve().parents[1]
+DATABASE_PATH = ROOT / "database.py"
+
+
+class _Postgres:
+    """Счётчик xid, последовательность id событий и видимость по снимкам (READ COMMITTED)."""
+
+    def __init__(self, last_id=100):
+        self.next_xid = 500
+        self.last_id = last_id
+        self.running = set()
+        # id -> (settle_xmax, xid писателя); события до колонки — NULL
+        self.rows = {event_id: (None, 1) for event_id in range(1, last_id + 1)}
+        self.committed = {1}
+
+    def begin(self):
+        return _Txn(self)
+
+    def snapshot(self):
+        xmax = self.next_xid
+        xmin = min(self.running, default=xmax)
+        return xmin, xmax
+
+    def settled_version(self):
+        """SHIFT_AUCTION_SETTLED_VERSION_SQL: наибольший видимый id, чей settle_xmax
+        не выше xmin снимка читателя."""
+        xmin, _ = self.snapshot()
+        visible = [
+            event_id for event_id, (settle_xmax, xid) in self.rows.items()
+            if xid in self.committed and (settle_xmax is None or settle_xmax <= xmin)
+        ]
+        return max(visible, default=0)
+
+    def max_visible_id(self):
+        return max(event_id for event_id, (_, xid) in self.rows.items() if xid in self.committed)
+
+    def changes_since(self, since, version):
+        return sorted(
+            event_id for event_id, (_, xid) in self.rows.items()
+            if xid in self.committed and since < event_id <= version
+        )
+
+
+class _Txn:
+    def __init__(self, db):
+        self.db = db
+        self.xid = None
+
+    def insert_event(self):
+        # SELECT txid_current(), nextval(...): xid выдаётся раньше id
+        if self.xid is None:
+            self.xid = self.db.next_xid
+            self.db.next_xid += 1
+            self.db.running.add(self.xid)
+        self.db.last_id += 1
+        event_id = self.db.last_id
+        # INSERT ... txid_snapshot_xmax(txid_current_snapshot()) — снимок новой команды
+        _, settle_xmax = self.db.snapshot()
+        self.db.rows[event_id] = (settle_xmax, self.xid)
+        return event_id
+
+    def commit(self):
+        self.db.running.discard(self.xid)
+        self.db.committed.add(self.xid)
+
+    def rollback(self):
+        self.db.running.discard(self.xid)
+
+
+class SettledVersionModelTests(unittest.TestCase):
+    def test_lower_id_committing_after_higher_one_is_not_skipped(self):
+        db = _Postgres(last_id=102)
+        slow, fast = db.begin(), db.begin()
+        self.assertEqual(103, slow.insert_event())
+        self.assertEqual(104, fast.insert_event())
+        fast.commit()
+
+        # MAX(id) уже 104 — клиент с since=104 никогда не получил бы 103
+        self.assertEqual(104, db.max_visible_id())
+        client_version = db.settled_version()
+        self.assertEqual(102, client_version)
+
+        slow.commit()
+        version = db.settled_version()
+        self.assertEqual(104, version)
+        self.assertEqual([103, 104], db.changes_since(client_version, version))
+
+    def test_rolled_back_gap_does_not_hold_the_version(self):
+        db = _Postgres(last_id=102)
+        lost, kept = db.begin(), db.begin()
+        lost.insert_event()
+        kept.insert_event()
+        kept.commit()
+        self.assertEqual(102, db.settled_version())
+        lost.rollback()
+        self.assertEqual(104, db.settled_version())
+
+    def test_version_never_passes_an_id_still_in_flight(self):
+        # Перебор порядков фиксации трёх писателей: что бы ни было видно читателю,
+        # позже не может зафиксироваться id не выше уже отданной версии.
+        orders = [(0, 1, 2), (0, 2, 1), (1, 0, 2), (1, 2, 0), (2, 0, 1), (2, 1, 0)]
+        for order in orders:
+            with self.subTest(order=order):
+                db = _Postgres(last_id=10)
+                txns = [db.begin() for _ in range(3)]
+                ids = [txn.insert_event() for txn in txns]
+                for step, index in enumerate(order):
+                    version = db.settled_version()
+                    pending = [ids[i] for i in order[step:]]
+                    self.assertTrue(all(event_id > version for event_id in pending))
+                    txns[index].commit()
+                self.assertEqual(13, db.settled_version())
+
+
+class SettledVersionSourceTests(unittest.TestCase):
+    def test_insert_takes_xid_before_id_and_horizon_after_it(self):
+        source = ast.get_source_segment(
+            source_cache.read(DATABASE_PATH),
+            source_cache.function_node(DATABASE_PATH, "_insert_shift_auction_test_event", "Database"),
+        )
+        allocate = re.search(r"txid_current\(\),\s*nextval\(", source)
+        horizon = source.find("txid_snapshot_xmax(txid_current_snapshot())")
+        self.assertIsNotNone(allocate)
+        self.assertGreater(horizon, allocate.end())
+        self.assertIn("settle_xmax", source[allocate.end():])
+
+    def test_snapshot_reports_settled_id_as_version(self):
+        source = source_cache.read(DATABASE_PATH)
+        settled = next(
+            node for node in source_cache.tree(DATABASE_PATH).body
+            if isinstance(node, ast.Assign)
+            and any(getattr(t, "id", None) == "SHIFT_AUCTION_SETTLED_VERSION_SQL" for t in node.targets)
+        )
+        sql = " ".join(ast.literal_eval(settled.value).split())
+        self.assertIn(
+            "e.settle_xmax IS NULL OR e.settle_xmax <= txid_snapshot_xmin(txid_current_snapshot())", sql
+        )
+        self.assertIn("ORDER BY e.id DESC LIMIT 1", sql)
+
+        snapshot = ast.get_source_segment(
+            source, source_cache.function_node(DATABASE_PATH, "get_shift_auction_test_snapshot", "Database")
+        )
+        self.assertIn("SHIFT_AUCTION_SETTLED_VERSION_SQL + ", snapshot)
+        self.assertNotIn("MAX(id), 0) FROM shift_auction_test_events", snapshot)
+
+    def test_engine_lot_states_are_versioned_by_settled_id(self):
+        source = ast.get_source_segment(
+            source_cache.read(DATABASE_PATH),
+            source_cache.function_node(DATABASE_PATH, "get_shift_auction_lot_states", "Database"),
+        )
+        self.assertIn("SHIFT_AUCTION_SETTLED_VERSION_SQL + ", source)
+        self.assertNotIn("COALESCE(MAX(id)", source)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+"""Дельта-снимки аукциона: какие лоты задевают события и как их вклеивают обратно.
+
+Чистые хелперы достаются из database.py через ast — импортировать модуль нельзя.
+"""
+
+import ast
+import unittest
+from pathlib import Path
+
+from tests import source_cache
+
+
+ROOT = Path(__file__).resolve().parents[1]
+DATABASE_PATH = ROOT / "database.py"
+HELPERS = (
+    "_shift_auction_event_int",
+    "_shift_auction_events_patch_scope",
+    "_shift_auction_lot_operator_ids",
+    "_shift_auction_scope_lot_ids",
+    "_merge_shift_auction_lots",
+)
+
+
+def _load_helpers():
+    source = source_cache.read(DATABASE_PATH)
+    module = source_cache.tree(DATABASE_PATH)
+    namespace = {}
+    for node in module.body:
+        if isinstance(node, ast.Assign) and any(
+            isinstance(target, ast.Name) and target.id == "SHIFT_AUCTION_LOT_PATCH_EVENT_TYPES"
+            for target in node.targets
+        ):
+            exec(ast.get_source_segment(source, node), namespace)
+    for name in HELPERS:
+        exec(ast.get_source_segment(source, source_cache.function_node(DATABASE_PATH, name)), namespace)
+    return namespace
+
+
+NS = _load_helpers()
+
+
+class ShiftAuctionPatchScopeTests(unittest.TestCase):
+    def test_lot_events_collect_lots_source_shifts_and_operators(self):
+        scope = NS["_shift_auction_events_patch_scope"]([
+            ("lot_claimed", {
+                "lot": {
+                    "id": 11,
+                    "claimed_by": 5,
+                    "source_schedule_plan_id": 3,
+                    "source_schedule_shift_id": 40,
+                    "claim_segments": [{"claimed_by": 6}],
+                },
+            }),
+            ("day_off_selected", {"operator_id": "7"}),
+        ])
+
+        self.assertEqual({11}, scope["lot_ids"])
+        self.assertEqual({(3, 40)}, scope["source_pairs"])
+        self.assertEqual({5, 6, 7}, scope["operator_ids"])
+        self.assertEqual({"lot_claimed", "day_off_selected"}, scope["event_types"])
+
+    def test_structural_event_forces_full_snapshot(self):
+        self.assertIsNone(NS["_shift_auction_events_patch_scope"]([
+            ("lot_claimed", {"lot_id": 1}),
+            ("plan_published", {}),
+        ]))
+
+    def test_source_shift_pulls_in_sibling_post_claim_lots(self):
+        lots = [
+            {"id": 1, "source_schedule_plan_id": 3, "source_schedule_shift_id": 40},
+            {"id": 2, "source_schedule_plan_id": 3, "source_schedule_shift_id": 40},
+            {"id": 3, "source_schedule_plan_id": 3, "source_schedule_shift_id": 41},
+        ]
+        scope = {"lot_ids": {9}, "source_pairs": {(3, 40)}}
+
+        self.assertEqual({1, 2}, NS["_shift_auction_scope_lot_ids"](lots, scope))
+
+
+class ShiftAuctionLotMergeTests(unittest.TestCase):
+    def test_merge_replaces_drops_and_keeps_full_build_order(self):
+        lots = [
+            {"id": 1, "shift_date": "2026-10-20", "start_time": "09:00", "status": "open"},
+            {"id": 2, "shift_date": "2026-10-20", "start_time": "12:00", "status": "open"},
+            {"id": 3, "shift_date": "2026-10-21", "start_time": "09:00", "status": "open"},
+        ]
+        fresh = [
+            {"id": 2, "shift_date": "2026-10-20", "start_time": "12:00", "status": "claimed"},
+            {"id": 4, "shift_date": "2026-10-20", "start_time": "10:00", "status": "open"},
+        ]
+
+        merged = NS["_merge_shift_auction_lots"](lots, fresh, {2, 3, 4})
+
+        self.assertEqual([1, 4, 2], [lot["id"] for lot in merged])
+        self.assertEqual("claimed", merged[2]["status"])
+
+    def test_lot_operators_include_post_claim_segments(self):
+        lot = {"claimed_by": None, "claim_segments": [{"claimed_by": 8}, {"claimed_by": "9"}, "junk"]}
+
+        self.assertEqual({8, 9}, NS["_shift_auction_lot_operator_ids"](lot))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,255 @@
+"""Асинхронный SSE-шлюз (sse_gateway.py): возобновление ленты аукциона, колокол, допуск.
+
+Буфер аукциона — маленькая копия монолитного (условная переменная + список),
+авторизация — функция без Flask: шлюз о них знает только через аргументы.
+"""
+
+import asyncio
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+from pathlib import Path
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import sse_gateway  # noqa: E402
+from notifications import realtime  # noqa: E402
+
+
+class _AuctionBuffer:
+    def __init__(self, events=(), floor=None):
+        self.condition = threading.Condition()
+        self.events = list(events)
+        self.signal = 0
+        self.floor = floor
+        self.catchups = []
+
+    def publish(self, event):
+        with self.condition:
+            self.events.append(event)
+            self.signal += 1
+            self.condition.notify_all()
+
+    def read(self, after_id):
+        with self.condition:
+            floor = self.floor if self.floor is not None else (self.events[0]['id'] if self.events else None)
+            covered = floor is None or after_id + 1 >= floor
+            return [e for e in self.events if e['id'] > after_id], covered, self.signal, floor
+
+    def catchup(self, after_id):
+        self.catchups.append(after_id)
+        return [{'id': after_id + 1, 'event_type': 'from_db', 'payload': {}, 'created_at': None}]
+
+    def current(self):
+        with self.condition:
+            return self.signal
+
+    def wait(self, last, timeout):
+        with self.condition:
+            if self.signal <= last:
+                self.condition.wait(timeout)
+            return self.signal
+
+
+def _event(event_id):
+    return {'id': event_id, 'event_type': 'bid', 'payload': {'n': event_id}, 'created_at': None}
+
+
+def _authorize(stream, method, headers, query_string, remote_addr):
+    headers = dict(headers)
+    if method == 'OPTIONS':
+        return sse_gateway.AuthVerdict(None, 200, [('Access-Control-Allow-Origin', 'https://szov.pages.dev')], b'{}')
+    if 'Authorization' not in headers:
+        return sse_gateway.AuthVerdict(None, 401, [('Content-Type', 'application/json')], b'{"error": "Unauthorized"}')
+    return sse_gateway.AuthVerdict(int(headers['Authorization']), 204, [('Set-Cookie', 'access=rotated')])
+
+
+class SseGatewayTest(unittest.IsolatedAsyncioTestCase):
+    async def _client(self, buffer, **kwargs):
+        gateway = sse_gateway.SseGateway(
+            authorize=_authorize,
+            auction_read=buffer.read,
+            auction_catchup=buffer.catchup,
+            auction_signal=buffer.current,
+            auction_wait=buffer.wait,
+            auction_ensure_listener=lambda: None,
+            bell_listen_connect=lambda: None,
+            pump_wait_seconds=0.1,
+            **kwargs,
+        )
+        # Слушатель колокола в тесте не нужен: тычки публикуем руками.
+        gateway._bell_listener_ready = True
+        client = TestClient(TestServer(gateway.make_app()))
+        await client.start_server()
+        self.addAsyncCleanup(client.close)
+        return gateway, client
+
+    async def _read_until(self, response, marker):
+        text = ''
+        while marker not in text:
+            chunk = await asyncio.wait_for(response.content.readany(), timeout=3)
+            self.assertTrue(chunk, 'поток закрылся раньше времени')
+            text += chunk.decode('utf-8')
+        return text
+
+    async def test_auction_resumes_after_cursor_and_streams_live_events(self):
+        buffer = _AuctionBuffer([_event(1), _event(2), _event(3)])
+        _, client = await self._client(buffer)
+        response = await client.get(sse_gateway.STREAM_PATHS['shift_auction'] + '?after=1',
+                                    headers={'Authorization': '7'})
+        self.assertEqual(200, response.status)
+        self.assertEqual('access=rotated', response.headers['Set-Cookie'])
+        text = await self._read_until(response, 'id: 3\n')
+        self.assertNotIn('id: 1\n', text)
+        self.assertIn('id: 2\n', text)
+
+        buffer.publish(_event(4))
+        text = await self._read_until(response, 'id: 4\n')
+        self.assertIn('"n": 4', text)
+        response.close()
+
+    async def test_last_event_id_header_and_db_catchup(self):
+        buffer = _AuctionBuffer([_event(50)], floor=50)
+        _, client = await self._client(buffer)
+        response = await client.get(sse_gateway.STREAM_PATHS['shift_auction'],
+                                    headers={'Authorization': '7', 'Last-Event-ID': '10'})
+        text = await self._read_until(response, 'id: 50\n')
+        self.assertEqual(10, buffer.catchups[0])
+        self.assertIn('event: from_db', text)
+        response.close()
+
+    async def test_refusal_is_relayed_as_is(self):
+        _, client = await self._client(_AuctionBuffer())
+        response = await client.get(sse_gateway.STREAM_PATHS['shift_auction'])
+        self.assertEqual(401, response.status)
+        self.assertEqual({'error': 'Unauthorized'}, await response.json())
+        preflight = await client.options(sse_gateway.STREAM_PATHS['bell'])
+        self.assertEqual('https://szov.pages.dev', preflight.headers['Access-Control-Allow-Origin'])
+
+    async def test_bell_reloads_only_the_addressed_user(self):
+        gateway, client = await self._client(_AuctionBuffer())
+        mine = await client.get(sse_gateway.STREAM_PATHS['bell'], headers={'Authorization': '7'})
+        other = await client.get(sse_gateway.STREAM_PATHS['bell'], headers={'Authorization': '8'})
+        await self._read_until(mine, ': connected')
+        await self._read_until(other, ': connected')
+        self.assertEqual(2, gateway.snapshot()['active_streams']['bell'])
+
+        realtime._publish(frozenset({7}))
+        await self._read_until(mine, 'event: reload')
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(other.content.readany(), timeout=0.3)
+        mine.close()
+        other.close()
+
+    async def test_bell_delta_mode_builds_frames_in_the_pool(self):
+        built = []
+
+        def delta_frame(user_id, requester, changes, limit, seq):
+            built.append((user_id, sorted(changes.sources), limit, seq))
+            return f"id: {seq}\nevent: delta\ndata: {{}}\n\n"
+
+        # Курсор — сквозной номер (его мог выдать и соседний процесс); время
+        # публикации разнесено дальше окна склейки, чтобы отступ не захватил соседей.
+        now = time.monotonic()
+        for offset, source, event_id in ((100, 'tasks', 90000), (110, 'crm', 90001)):
+            with mock.patch.object(realtime.time, 'monotonic', return_value=now + offset):
+                realtime._publish(frozenset({7}), frozenset({source}), event_ids=(event_id,))
+        start = realtime.current_seq()
+        _, client = await self._client(_AuctionBuffer(), bell_delta_frame=delta_frame)
+        resumed = await client.get(sse_gateway.STREAM_PATHS['bell'] + '?mode=delta&limit=9&after=90000',
+                                   headers={'Authorization': '7'})
+        text = await self._read_until(resumed, 'event: delta')
+        self.assertIn('id: %d\n' % start, text, 'пропущенное дослано по курсору')
+        self.assertEqual([(7, ['crm'], '9', start)], built)
+
+        realtime._publish(frozenset({7}), None)
+        await self._read_until(resumed, 'event: reload')
+        resumed.close()
+
+
+class SseGatewayUpstreamTest(unittest.IsolatedAsyncioTestCase):
+    """Шлюз на публичном порту: потоки у себя, остальное — в waitress (здесь — aiohttp-эхо)."""
+
+    async def _front(self, upstream_app):
+        if upstream_app is not None:
+            upstream = TestServer(upstream_app)
+            await upstream.start_server()
+            self.addAsyncCleanup(upstream.close)
+            base = str(upstream.make_url('')).rstrip('/')
+        else:
+            base = 'http://127.0.0.1:9'  # discard — соединение отвергнут
+        buffer = _AuctionBuffer([_event(1)])
+        gateway = sse_gateway.SseGateway(
+            authorize=_authorize,
+            auction_read=buffer.read,
+            auction_catchup=buffer.catchup,
+            auction_signal=buffer.current,
+            auction_wait=buffer.wait,
+            auction_ensure_listener=lambda: None,
+            pump_wait_seconds=0.1,
+            upstream=base,
+        )
+        client = TestClient(TestServer(gateway.make_app()))
+        await client.start_server()
+        self.addAsyncCleanup(client.close)
+        return client
+
+    @staticmethod
+    def _echo_app(seen):
+        async def echo(request):
+            seen.append((request.method, request.raw_path, dict(request.headers), await request.read()))
+            return web.Response(status=201, body=b'waitress:' + await request.read(),
+                                headers={'Set-Cookie': 'access=rotated', 'X-Upstream': 'yes'})
+
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', echo)
+        return app
+
+    async def test_other_routes_pass_through_with_body_query_and_headers(self):
+        seen = []
+        client = await self._front(self._echo_app(seen))
+        response = await client.post('/api/tasks/save?id=5&q=%D0%B0', data=b'{"a": 1}',
+                                     headers={'Authorization': '7', 'X-Forwarded-For': '10.0.0.1',
+                                              'Host': 'otp.example'})
+        self.assertEqual(201, response.status)
+        self.assertEqual(b'waitress:{"a": 1}', await response.read())
+        self.assertEqual('yes', response.headers['X-Upstream'])
+        self.assertEqual('access=rotated', response.headers['Set-Cookie'])
+
+        method, raw_path, headers, body = seen[0]
+        self.assertEqual(('POST', '/api/tasks/save?id=5&q=%D0%B0', b'{"a": 1}'), (method, raw_path, body))
+        self.assertEqual('7', headers['Authorization'])
+        self.assertEqual('otp.example', headers['Host'])
+        self.assertEqual('10.0.0.1', headers['X-Forwarded-For'].split(',')[0])
+
+    async def test_stream_paths_stay_on_the_gateway(self):
+        seen = []
+        client = await self._front(self._echo_app(seen))
+        response = await client.get(sse_gateway.STREAM_PATHS['shift_auction'], headers={'Authorization': '7'})
+        self.assertEqual('text/event-stream', response.headers['Content-Type'])
+        response.close()
+        # Прочие методы на пути потока — уже маршрут waitress.
+        await client.post(sse_gateway.STREAM_PATHS['shift_auction'], data=b'')
+        self.assertEqual(['POST'], [method for method, *_ in seen])
+
+    async def test_unreachable_waitress_is_502(self):
+        client = await self._front(None)
+        response = await client.get('/api/health')
+        self.assertEqual(502, response.status)
+
+
+class ResumeEventIdTest(unittest.TestCase):
+    def test_after_wins_and_garbage_is_ignored(self):
+        self.assertEqual(5, sse_gateway.resume_event_id('5', '9'))
+        self.assertEqual(9, sse_gateway.resume_event_id(None, '9'))
+        self.assertEqual(0, sse_gateway.resume_event_id('x', ''))
+
+
+if __name__ == "__main__":
+    unittest.main()
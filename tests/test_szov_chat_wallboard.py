@@ -69,6 +69,8 @@ NAMES = {
     '_szov_chat_wallboard_fetch_events',
     '_szov_chat_wallboard_fetch_snapshot',
     '_wallboard_snapshot_with_cache',
+    '_shared_cache_read',
+    '_shared_cache_write',
     '_szov_chat_wallboard_snapshot',
 }
 
@@ -116,7 +118,7 @@ class _Harness:
             'threading': threading,
             'datetime': datetime,
             'ZoneInfo': ZoneInfo,
-            'requests': fake_requests,
+            '_chat2desk_session': fake_requests,
             're': __import__('re'),
             '_env_int': lambda name, default, minimum=None, maximum=None: default,
             'CHAT2DESK_API_PAGE_LIMIT': 200,
@@ -126,6 +128,7 @@ class _Harness:
             'CHAT_HOURLY_REQUEST_TYPE': 'common',
             'CHAT2DESK_STATISTICS_REPORT_REQUEST_STATS': 'request_stats',
             'db': _FakeDb(members={1: members if members is not None else {18, 37, 149, 235}}),
+            'SHARED_CACHE_ENABLED': True,
             '_chat2desk_authorization_header': lambda: 'token',
             '_chat2desk_api_base_url': lambda: 'https://api.example',
             '_chat2desk_api_error_message': lambda response, report, day: f'HTTP {response.status_code}',
@@ -1081,6 +1084,14 @@ class ChatWallboardExportPeriodTests(unittest.TestCase):
             self._period('2026-08-12', '2026-08-19')  # восемь суток
         self.assertIn('7 суток', str(refused.exception))
 
+    def test_background_job_has_its_own_ceiling(self):
+        """Фоновой выгрузке (export_jobs) месяц разрешён, синхронной — по-прежнему нет."""
+        days = self.ns['_szov_chat_export_period']('2026-07-20', '2026-08-19', date(2026, 8, 19), 92)
+        self.assertEqual((days[0], days[-1], len(days)), ('2026-07-20', '2026-08-19', 31))
+        with self.assertRaises(ValueError) as refused:
+            self.ns['_szov_chat_export_period']('2026-01-01', '2026-08-19', date(2026, 8, 19), 92)
+        self.assertIn('92 суток', str(refused.exception))
+
     def test_file_name_says_what_is_inside(self):
         name = self.ns['_szov_chat_export_file_name']
         self.assertEqual(name({'from': '2026-08-17', 'to': '2026-08-19'}),
@@ -12,6 +12,7 @@ import os
 import re
 import shutil
 import subprocess
+import sys
 import tempfile
 import threading
 import time
@@ -23,6 +24,9 @@ from tests import source_cache
 
 
 ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import oktell_gateway  # noqa: E402
 
 
 def _load_names(source, names, namespace, label="<szov-wallboard>"):
@@ -47,16 +51,20 @@ def _load_names(source, names, namespace, label="<szov-wallboard>"):
 
 
 class _FakeDb:
-    """Минимальный db: отделы, отдел пользователя, состав отдела, сохранённый снимок табло."""
+    """Минимальный db: отделы, отдел пользователя, состав отдела, сохранённый снимок табло.
+
+    shared — словарь-«таблица» общего кэша процессов; один на несколько _FakeDb — это
+    несколько процессов на одной базе. Без него общий кэш недоступен, как без таблицы."""
 
     def __init__(self, departments=None, user_departments=None, members=None,
-                 wallboard_snapshot=None, snapshot_error=False):
+                 wallboard_snapshot=None, snapshot_error=False, shared=None):
         self.departments = departments if departments is not None else [{'id': 1, 'code': 'szov'}]
         self.user_departments = user_departments or {}
         self.members = members or {}
         self.wallboard_snapshot = wallboard_snapshot  # (payload, captured_at)
         self.snapshot_error = snapshot_error
         self.saved_snapshots = []
+        self.shared = shared
 
     def get_departments(self):
         return self.departments
@@ -78,6 +86,20 @@ class _FakeDb:
         self.saved_snapshots.append((payload, captured_at))
         self.wallboard_snapshot = (payload, captured_at)
 
+    def shared_cache_get(self, key):
+        if self.shared is None:
+            raise RuntimeError('relation "shared_cache" does not exist')
+        value, expires_at = self.shared.get(key, (None, None))
+        if expires_at is None or expires_at <= time.time():
+            return None, None
+        return value, expires_at
+
+    def shared_cache_put(self, key, value, ttl_seconds, keep_remaining_seconds=None):
+        if self.shared is None:
+            raise RuntimeError('relation "shared_cache" does not exist')
+        self.shared[key] = (value, time.time() + ttl_seconds)
+        return self.shared[key]
+
 
 class SzovWallboardBackendGuardTests(unittest.TestCase):
     """Доступ: глобальные админы, глава СЗоВ, СВ СЗоВ. Чужие отделы — 403."""
@@ -105,6 +127,7 @@ class SzovWallboardBackendGuardTests(unittest.TestCase):
             ),
             '_is_supervisor_role': lambda r: str(r or '').lower() == 'sv',
             '_headed_department_id': lambda rid: headed_department_id,
+            '_user_department_id': lambda rid: user_department_id if rid == requester_id else None,
         }
         _load_names(source, {
             'SZOV_WALLBOARD_DEPARTMENT_CODE',
@@ -474,7 +497,7 @@ class _SnapshotHarness:
         source = (ROOT / "bot_schedule2.py").read_text(encoding="utf-8-sig")
         state = {'calls': 0, 'timeouts': []}
 
-        def fake_query(sql, timeout=None):
+        def fake_query(sql, timeout=None, **_kwargs):
             state['calls'] += 1
             state['timeouts'].append(timeout)
             if fail:
@@ -493,7 +516,9 @@ class _SnapshotHarness:
             '_env_int': lambda name, default, minimum=None, maximum=None: default,
             'OKTELL_BILLING_SL_DEFAULT_SECONDS': 20,
             '_oktell_query': fake_query,
+            'oktell_gateway': oktell_gateway,
             'db': db if db is not None else _FakeDb(members={1: {10, 11}}),
+            'SHARED_CACHE_ENABLED': True,
             '_status_import_build_operator_lookup': lambda restrict_to_ids=None: {'lookup': True},
             '_status_import_resolve_operator_matches': lambda name, lookup: [],
         }
@@ -526,6 +551,8 @@ class _SnapshotHarness:
             '_oktell_wallboard_operator_states_sql',
             '_oktell_wallboard_snapshot_sql',
             '_wallboard_snapshot_with_cache',
+            '_shared_cache_read',
+            '_shared_cache_write',
             '_szov_wallboard_restore_cache',
             '_szov_wallboard_persist_cache',
             '_szov_wallboard_fetch_snapshot',
@@ -614,7 +641,7 @@ class SzovWallboardSnapshotTests(_SnapshotHarness, unittest.TestCase):
 
         broken_calls = {'n': 0}
 
-        def broken(sql, timeout=None):
+        def broken(sql, timeout=None, **_kwargs):
             broken_calls['n'] += 1
             raise RuntimeError("Oktell proxy HTTP 500")
 
@@ -627,6 +654,42 @@ class SzovWallboardSnapshotTests(_SnapshotHarness, unittest.TestCase):
         self.assertGreaterEqual(stale['age_seconds'], 60)
 
 
+    def test_processes_share_one_oktell_query_per_ttl(self):
+        """Второй процесс waitress берёт снимок соседа из общего кэша, а не идёт в Oktell."""
+        shared = {}
+        first = self._namespace(db=_FakeDb(members={1: {10, 11}}, shared=shared))
+        second = self._namespace(db=_FakeDb(members={1: {10, 11}}, shared=shared))
+
+        made = first['_szov_wallboard_snapshot']()
+        taken = second['_szov_wallboard_snapshot']()
+
+        self.assertEqual(1, first['_query_state']['calls'])
+        self.assertEqual(0, second['_query_state']['calls'])
+        self.assertFalse(taken['stale'])
+        self.assertEqual(made['generated_at'], taken['generated_at'])
+
+    def test_source_failure_pauses_every_process(self):
+        shared = {}
+        first = self._namespace(db=_FakeDb(members={1: {10, 11}}, shared=shared))
+        second = self._namespace(db=_FakeDb(members={1: {10, 11}}, shared=shared))
+        first['_szov_wallboard_snapshot']()
+        second['_szov_wallboard_snapshot']()
+
+        def broken(sql, timeout=None, **_kwargs):
+            raise RuntimeError("Oktell proxy HTTP 500")
+
+        first['_oktell_query'] = broken
+        first['_szov_wallboard_cache']['ts'] = time.time() - 60
+        second['_szov_wallboard_cache']['ts'] = time.time() - 60
+        shared['szov_wallboard:line'][0]['ts'] = time.time() - 60
+        self.assertTrue(first['_szov_wallboard_snapshot']()['stale'])
+
+        # Сосед не повторяет запрос в пределах паузы — отдаёт тот же снимок как устаревший.
+        stale = second['_szov_wallboard_snapshot']()
+        self.assertTrue(stale['stale'])
+        self.assertIn('500', stale['error'])
+        self.assertEqual(0, second['_query_state']['calls'])
+
     def test_error_propagates_when_no_snapshot_ever_succeeded(self):
         ns = self._namespace(fail=True)
         with self.assertRaises(RuntimeError):
@@ -637,13 +700,15 @@ class SzovWallboardSnapshotTests(_SnapshotHarness, unittest.TestCase):
         ns = self._namespace()
         seen = []
 
-        def capturing(sql, timeout=None):
-            seen.append(timeout)
+        def capturing(sql, timeout=None, **kwargs):
+            seen.append((timeout, kwargs.get('priority')))
             return [dict(self.TOTALS_ROW)]
 
         ns['_oktell_query'] = capturing
         ns['_szov_wallboard_fetch_snapshot']()
-        self.assertEqual(seen, [ns['SZOV_WALLBOARD_OKTELL_TIMEOUT_SECONDS']])
+        # И вне очереди шлюза: слот к прокси табло получает раньше отчётов и синков.
+        self.assertEqual(seen, [(ns['SZOV_WALLBOARD_OKTELL_TIMEOUT_SECONDS'],
+                                 oktell_gateway.PRIORITY_WALLBOARD)])
         self.assertLess(ns['SZOV_WALLBOARD_OKTELL_TIMEOUT_SECONDS'], 60)
 
     def test_second_viewer_does_not_queue_behind_a_slow_refresh(self):
@@ -672,7 +737,7 @@ class SzovWallboardSnapshotTests(_SnapshotHarness, unittest.TestCase):
 
         attempts = {'n': 0}
 
-        def broken(sql, timeout=None):
+        def broken(sql, timeout=None, **_kwargs):
             attempts['n'] += 1
             raise RuntimeError("Oktell proxy connect timeout")
 
@@ -715,7 +780,7 @@ class SzovWallboardSnapshotTests(_SnapshotHarness, unittest.TestCase):
         ns = self._namespace()
         ns['_szov_wallboard_snapshot']()
 
-        def broken(sql, timeout=None):
+        def broken(sql, timeout=None, **_kwargs):
             raise RuntimeError("Oktell proxy HTTP 500")
 
         ns['_oktell_query'] = broken
@@ -1199,7 +1264,7 @@ class SzovBroadcastTests(unittest.TestCase):
     def _namespace(self, hourly_raw=None, snapshot=None, shift_rows=None, break_violations=None):
         source = (ROOT / "bot_schedule2.py").read_text(encoding="utf-8-sig")
 
-        def fake_oktell(sql, timeout=None):
+        def fake_oktell(sql, timeout=None, **_kwargs):
             return list(hourly_raw if hourly_raw is not None else self.HOURLY_RAW)
 
         def no_snapshot():
@@ -1210,6 +1275,7 @@ class SzovBroadcastTests(unittest.TestCase):
             'datetime': datetime, 'ZoneInfo': ZoneInfo,
             '_env_int': lambda name, default, minimum=None, maximum=None: default,
             '_oktell_query': fake_oktell,
+            'oktell_gateway': oktell_gateway,
             'SZOV_WALLBOARD_OKTELL_TIMEOUT_SECONDS': 20,
             '_szov_wallboard_snapshot': (lambda: snapshot) if snapshot is not None else no_snapshot,
             # смены считает отдельный серверный расчёт — в этих тестах он не участвует
@@ -1564,9 +1630,9 @@ class SzovBroadcastWiringTests(unittest.TestCase):
         self.assertIn("@app.route('/api/szov_wallboard/broadcast_preview', methods=['GET', 'OPTIONS'])", self.api)
         # журнал нарушений перерывов смотрят те же, кто смотрит табло, — гейт табло
         self.assertIn("@app.route('/api/szov_wallboard/break_violations', methods=['GET', 'OPTIONS'])", self.api)
-        # оба табло (линия и чаты), выгрузка показателей чатов и журнал перерывов — на своём
-        # гейте, вся отбивка (настройка, предпросмотр, отправка) — на строгом
-        self.assertEqual(self.api.count("requester_id, err = _szov_wallboard_guard()"), 4)
+        # оба табло (линия и чаты), выгрузка показателей чатов (сразу и фоновой задачей) и
+        # журнал перерывов — на своём гейте, вся отбивка (настройка, предпросмотр, отправка) — на строгом
+        self.assertEqual(self.api.count("requester_id, err = _szov_wallboard_guard()"), 5)
         self.assertEqual(self.api.count("requester_id, err = _szov_broadcast_guard()"), 3)
 
     def test_preview_never_sends_anything(self):
@@ -1,4 +1,5 @@
 import ast
+import logging
 import unittest
 from contextlib import contextmanager
 from pathlib import Path
@@ -57,14 +58,22 @@ def _load_function(name, namespace):
     return namespace[name]
 
 
+def _load_headed_department_id(namespace):
+    # «Глава отдела» читается из портрета пользователя (_principal_scope):
+    # кэш в g и работа вне контекста Flask живут там.
+    namespace.setdefault("logging", logging)
+    _load_function("_principal_scope", namespace)
+    return _load_function("_headed_department_id", namespace)
+
+
 class _DeptDatabase:
     def __init__(self, dept_id):
         self.dept_id = dept_id
         self.calls = 0
 
-    def headed_department_id_for_user(self, requester_id):
+    def get_user_principal_scope(self, requester_id):
         self.calls += 1
-        return self.dept_id
+        return {"department_id": None, "headed_department_ids": (self.dept_id,)}
 
 
 class _OutsideContextG:
@@ -154,7 +163,7 @@ class TelegramReevaluationDecisionTests(unittest.TestCase):
         # где обращение к Flask `g` бросает RuntimeError. Раньше это всплывало как
         # «запрос уже обработан». Функция должна отработать через БД и не падать.
         database = _DeptDatabase(7)
-        fn = _load_function("_headed_department_id", {"g": _OutsideContextG(), "db": database})
+        fn = _load_headed_department_id({"g": _OutsideContextG(), "db": database})
 
         self.assertEqual(fn(2), 7)
         self.assertEqual(database.calls, 1)
@@ -167,7 +176,7 @@ class TelegramReevaluationDecisionTests(unittest.TestCase):
             pass
 
         database = _DeptDatabase(5)
-        fn = _load_function("_headed_department_id", {"g": _CtxG(), "db": database})
+        fn = _load_headed_department_id({"g": _CtxG(), "db": database})
 
         self.assertEqual(fn(2), 5)
         self.assertEqual(fn(2), 5)
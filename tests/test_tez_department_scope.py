@@ -222,7 +222,8 @@ class TezDepartmentBackendScopeTests(unittest.TestCase):
 
     def test_hours_and_technical_issue_targets_use_department_scope(self):
         daily_hours = _function_source(BOT_PATH, "sv_daily_hours")
-        monthly_report = _function_source(BOT_PATH, "get_monthly_report_hours")
+        # Права отчёта вынесены в помощник: его делят GET-ручка и постановка фоновой задачи.
+        monthly_report = _function_source(BOT_PATH, "_monthly_hours_report_scope")
         resolver = _function_source(
             DATABASE_PATH,
             "_resolve_technical_issue_operator_ids_tx",
@@ -78,6 +78,10 @@ class TezOpChatRollupTests(unittest.TestCase):
         instance = FakeDatabase()
         instance._get_cursor = fake_cursor
         instance._get_operator_group_id_tx = lambda _cursor, operator_id, day: 700 + int(operator_id)
+        instance.rollup_refreshes = []
+        instance._refresh_operator_month_rollups_tx = (
+            lambda _cursor, **kwargs: instance.rollup_refreshes.append(kwargs)
+        )
         return instance
 
     def test_chat_is_counted_for_every_operator_who_wrote(self):
@@ -107,6 +111,10 @@ class TezOpChatRollupTests(unittest.TestCase):
         self.assertEqual([row[0] for row in captured["values"]], [11, 22])
         self.assertEqual(result["saved_days"], 2)
         self.assertEqual(result["chats"], 6)
+        self.assertEqual(
+            [{"operator_ids": {11, 22}, "months": {"2026-07"}}],
+            db.rollup_refreshes,
+        )
 
     def test_refresh_clears_old_values_before_upsert(self):
         day = date(2026, 7, 21)
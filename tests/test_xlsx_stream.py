@@ -0,0 +1,109 @@
+"""Потоковая запись XLSX (xlsx_stream.py): openpyxl-подобные листы на constant_memory.
+
+Файл собираем настоящим xlsxwriter и читаем обратно openpyxl — так проверяется
+и перевод стилей, и то, что Excel увидит то же, что писал построитель отчёта.
+"""
+
+import sys
+import unittest
+from io import BytesIO
+from pathlib import Path
+
+from openpyxl import load_workbook
+from openpyxl.cell.rich_text import CellRichText, TextBlock
+from openpyxl.cell.text import InlineFont
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import xlsx_stream  # noqa: E402
+
+
+def _roundtrip(build):
+    out = BytesIO()
+    wb = xlsx_stream.StreamingWorkbook(out)
+    build(wb)
+    wb.close()
+    return load_workbook(BytesIO(out.getvalue()), rich_text=True)
+
+
+class StreamingWorkbookTest(unittest.TestCase):
+    def test_values_styles_and_sheet_settings_survive(self):
+        def build(wb):
+            ws = wb.create_sheet('Часы')
+            header = ws.cell(1, 1)
+            header.value = 'Оператор'
+            header.font = Font(bold=True, color='DC2626')
+            header.border = Border(left=Side(style='thin'))
+            day = ws.cell(2, 2)
+            day.value = 7.5
+            day.number_format = '0.##'
+            day.fill = PatternFill(fill_type='solid', start_color='b3b3b3')
+            day.alignment = Alignment(horizontal='center', vertical='center', wrapText=True)
+            ws.cell(2, 1).value = '=не формула'
+            ws.cell(2, 3).value = 3
+            ws.row_dimensions[2].height = 42
+            ws.column_dimensions['A'].width = 24
+            ws.freeze_panes = 'B2'
+            wb.create_sheet('Пусто')
+
+        book = _roundtrip(build)
+        self.assertEqual(['Часы', 'Пусто'], book.sheetnames)
+        ws = book['Часы']
+        self.assertEqual('Оператор', ws.cell(1, 1).value)
+        self.assertTrue(ws.cell(1, 1).font.b)
+        self.assertEqual('FFDC2626', ws.cell(1, 1).font.color.rgb)
+        self.assertEqual('thin', ws.cell(1, 1).border.left.style)
+        self.assertEqual(7.5, ws.cell(2, 2).value)
+        self.assertEqual('0.##', ws.cell(2, 2).number_format)
+        self.assertEqual('FFB3B3B3', ws.cell(2, 2).fill.start_color.rgb)
+        self.assertTrue(ws.cell(2, 2).alignment.wrap_text)
+        self.assertEqual('center', ws.cell(2, 2).alignment.vertical)
+        self.assertEqual('=не формула', ws.cell(2, 1).value)
+        self.assertEqual(3, ws.cell(2, 3).value)
+        self.assertEqual(42, ws.row_dimensions[2].height)
+        self.assertEqual('B2', ws.freeze_panes)
+
+    def test_rich_text_single_and_multi_fragment(self):
+        red = InlineFont(color='DC2626', b=True)
+        grey = InlineFont(color='6B7280')
+
+        def build(wb):
+            ws = wb.create_sheet('Штрафы')
+            ws.cell(1, 1).value = CellRichText([TextBlock(red, '150'), TextBlock(grey, ', '), TextBlock(red, '700')])
+            ws.cell(1, 2).value = CellRichText([TextBlock(red, '10 000')])
+            empty = ws.cell(1, 3)
+            empty.value = CellRichText([])
+            empty.border = Border(left=Side(style='thin'))
+
+        ws = _roundtrip(build)['Штрафы']
+        self.assertEqual('150, 700', str(ws.cell(1, 1).value))
+        self.assertEqual('10 000', ws.cell(1, 2).value)
+        self.assertTrue(ws.cell(1, 2).font.b)
+        self.assertIsNone(ws.cell(1, 3).value)
+        self.assertEqual('thin', ws.cell(1, 3).border.left.style)
+
+    def test_rows_are_buffered_until_the_builder_moves_on(self):
+        out = BytesIO()
+        wb = xlsx_stream.StreamingWorkbook(out)
+        ws = wb.create_sheet('Лист')
+        first = ws.cell(1, 1)
+        first.value = 'a'
+        # Та же строка — ещё в буфере, стиль можно донастроить после записи.
+        ws.cell(1, 2).value = 1
+        first.font = Font(bold=True)
+        ws.cell(3, 1).value = 'c'
+        with self.assertRaises(ValueError):
+            ws.cell(1, 1)
+        with self.assertRaises(ValueError):
+            ws.cell(2, 1)
+        with self.assertRaises(ValueError):
+            ws.row_dimensions[1].height = 10
+        wb.close()
+        book = load_workbook(BytesIO(out.getvalue()))
+        self.assertTrue(book['Лист'].cell(1, 1).font.b)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -35,13 +35,14 @@ import json
 import logging
 import os
 import re
-import threading
 import time
 from datetime import datetime, timedelta
 from pathlib import Path
 
 import requests
 
+import http_clients
+
 try:
     from zoneinfo import ZoneInfo
 except Exception:  # pragma: no cover
@@ -78,13 +79,13 @@ RECORDED_DISPOSITIONS = {"ANSWER", "ANSWERED", "SUCCESS", "VM-SUCCESS"}
 # recordingStatus из ответа Binotel, при котором запись реально доступна.
 RECORDED_STATUSES = {"uploaded"}
 # Binotel лимитирует частоту запросов (даёт ошибку status='error' «Requests are too
-# frequent. You can do this request after N sec.»). Клиент сериализует запросы,
-# разносит их во времени и повторяет при этой ошибке, учитывая подсказку сервера.
+# frequent. You can do this request after N sec.»). Темп держит общий слой
+# http_clients — на процесс, для всех нитей сразу: не чаще MIN_REQUEST_INTERVAL,
+# а на «too frequent» вся интеграция встаёт на паузу по подсказке сервера.
+# Повторяет отказанный запрос клиент (`_post`).
 MIN_REQUEST_INTERVAL = 1.0   # минимальный зазор между запросами к Binotel, сек
 RATE_LIMIT_MAX_RETRIES = 3   # сколько раз повторить при «too frequent»
 RATE_LIMIT_MAX_WAIT = 12     # потолок ожидания по подсказке сервера, сек
-_RATE_LOCK = threading.Lock()
-_LAST_REQUEST_AT = [0.0]     # monotonic-время последнего запроса (общий на процесс)
 
 
 def _too_frequent_wait_seconds(payload):
@@ -96,6 +97,18 @@ def _too_frequent_wait_seconds(payload):
     return int(m.group(1)) if m else 10
 
 
+def _too_frequent_response(resp):
+    """Признак ограничения для http_clients: «too frequent» приходит с HTTP 200 в теле."""
+    if resp.status_code != 200:
+        return None
+    try:
+        payload = resp.json()
+    except ValueError:
+        return None
+    wait = _too_frequent_wait_seconds(payload) if isinstance(payload, dict) else None
+    return None if wait is None else min(wait, RATE_LIMIT_MAX_WAIT) + 0.4
+
+
 def _parse_env_file(path):
     """Простой парсер .env (KEY=VALUE); кавычки снимаем."""
     data = {}
@@ -205,7 +218,9 @@ class BinotelApiClient:
         self.base_url = (base_url or DEFAULT_API_URL).rstrip("/")
         self.tz = tz or DEFAULT_TZ
         self.timeout = timeout
-        self.session = requests.Session()
+        self.session = http_clients.session(
+            "binotel", rate_per_second=1.0 / MIN_REQUEST_INTERVAL, burst=1,
+            throttled=_too_frequent_response)
 
     @classmethod
     def from_config(cls, config=None):
@@ -215,10 +230,10 @@ class BinotelApiClient:
     def _post(self, endpoint, params):
         """POST {base}/{endpoint}.json с key+secret. Возвращает распарсенный JSON.
 
-        Запросы к Binotel сериализуются и разносятся во времени (общий на процесс
-        замок + зазор MIN_REQUEST_INTERVAL), а на ошибку «too frequent» делается
-        ретрай с паузой по подсказке сервера — иначе второй запрос подряд (второе
-        7-дневное окно, фоновая докачка записи или повторный клик) валится в 502."""
+        Запросы к Binotel разносятся во времени (темп интеграции в http_clients,
+        общий на процесс), а на ошибку «too frequent» делается ретрай после паузы
+        по подсказке сервера — иначе второй запрос подряд (второе 7-дневное окно,
+        фоновая докачка записи или повторный клик) валится в 502."""
         url = f"{self.base_url}/{endpoint}.json"
         body = dict(params or {})
         body["key"] = self.api_key
@@ -226,15 +241,7 @@ class BinotelApiClient:
 
         last_rate_err = None
         for attempt in range(1, RATE_LIMIT_MAX_RETRIES + 1):
-            # Сериализуем запросы и выдерживаем минимальный зазор между ними.
-            with _RATE_LOCK:
-                gap = time.monotonic() - _LAST_REQUEST_AT[0]
-                if gap < MIN_REQUEST_INTERVAL:
-                    time.sleep(MIN_REQUEST_INTERVAL - gap)
-                try:
-                    resp = self.session.post(url, json=body, timeout=self.timeout)
-                finally:
-                    _LAST_REQUEST_AT[0] = time.monotonic()
+            resp = self.session.post(url, json=body, timeout=self.timeout)
 
             if resp.status_code != 200:
                 raise RuntimeError(f"Binotel HTTP {resp.status_code}: {resp.text[:300]}")
@@ -248,11 +255,12 @@ class BinotelApiClient:
 
             wait = _too_frequent_wait_seconds(payload)
             if wait is not None and attempt < RATE_LIMIT_MAX_RETRIES:
-                sleep_s = min(wait, RATE_LIMIT_MAX_WAIT) + 0.4  # пауза вне замка
+                # Паузу уже поставил http_clients (_too_frequent_response):
+                # следующий запрос любой нити дождётся её сам.
                 last_rate_err = payload.get('message') or payload.get('error') or 'too frequent'
-                log.info("Binotel %s: слишком часто, пауза %.1fs и повтор (попытка %d/%d)",
-                         endpoint, sleep_s, attempt, RATE_LIMIT_MAX_RETRIES)
-                time.sleep(sleep_s)
+                log.info("Binotel %s: слишком часто, повтор после паузы %.1fs (попытка %d/%d)",
+                         endpoint, min(wait, RATE_LIMIT_MAX_WAIT) + 0.4, attempt,
+                         RATE_LIMIT_MAX_RETRIES)
                 continue
 
             raise RuntimeError(
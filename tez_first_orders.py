@@ -55,6 +55,8 @@ from pathlib import Path
 
 import requests
 
+import http_clients
+
 from tez_op_leads import normalize_kz_phone, parse_first_order_at, to_e164
 
 
@@ -157,7 +159,7 @@ class TezFirstOrdersClient:
         self.token = token
         self.base_url = (base_url or DEFAULT_API_URL).rstrip("/")
         self.timeout = timeout
-        self.session = requests.Session()
+        self.session = http_clients.session("tez_app")
 
     @classmethod
     def from_config(cls, config=None):
@@ -154,13 +154,14 @@ def _http():
 
     Замер 22.08.2026: до Vertex по новому соединению 626 мс, по готовому 155 мс.
     Помощник делает такой запрос на каждый вопрос, и рукопожатие сидело прямо в
-    паузе перед ответом. httpx.Client потокобезопасен.
+    паузе перед ответом. httpx.Client потокобезопасен. Собирает его общий слой
+    интеграций: HTTP/2, если стоит h2 (запросы к провайдеру идут одним
+    соединением), задержки и 429 — в /api/admin/http_clients/stats.
     """
-    import httpx
+    import http_clients
 
-    return httpx.Client(timeout=TIMEOUT,
-                        limits=httpx.Limits(max_keepalive_connections=8,
-                                            max_connections=16))
+    return http_clients.httpx_client('wiki_ai', timeout=TIMEOUT,
+                                     max_keepalive_connections=8, max_connections=16)
 
 
 def _post(url, payload, headers, params=None, timeout=None):
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""Потоковая запись XLSX: openpyxl-подобные листы поверх xlsxwriter constant_memory.
+
+Отчёты «Учёта часов» (Database.generate_excel_report_from_view) строились в
+openpyxl целиком в памяти: десяток листов по строке на оператора и колонке на
+день — сотни тысяч объектов Cell со стилями на выгрузку отдела за месяц, плюс
+копия файла в BytesIO и ещё одна в bytes. Под waitress это и память процесса,
+и долгий запрос, который рвётся по channel_timeout.
+
+Модуль даёт тот же маленький кусок API openpyxl, которым пользуются
+построители отчётов (wb.create_sheet, ws.cell(r, c) со стилями
+Font/PatternFill/Alignment/Border/number_format, CellRichText,
+column_dimensions, row_dimensions, freeze_panes), а пишет через xlsxwriter в
+режиме constant_memory. Строка держится в буфере, пока построитель к ней
+обращается, и сбрасывается на диск, как только он перешёл к следующей: в
+памяти одновременно одна строка на лист. Поэтому построитель обязан писать
+строки сверху вниз — обращение к уже сброшенной строке бросает ValueError,
+а не теряет данные молча.
+
+Форматы xlsxwriter кэшируются по набору стилей: разных комбинаций в отчёте
+десятки, ячеек — сотни тысяч.
+"""
+
+from openpyxl.cell.rich_text import CellRichText, TextBlock
+from openpyxl.utils import column_index_from_string
+import xlsxwriter
+
+_BORDER_STYLES = {
+    'thin': 1, 'medium': 2, 'dashed': 3, 'dotted': 4, 'thick': 5,
+    'double': 6, 'hair': 7,
+}
+
+
+def _hex_color(color):
+    """openpyxl Color / 'AARRGGBB' / 'RRGGBB' → '#RRGGBB' (или None)."""
+    if color is None:
+        return None
+    rgb = getattr(color, 'rgb', color)
+    if not isinstance(rgb, str) or len(rgb) < 6:
+        return None
+    return '#' + rgb[-6:].upper()
+
+
+def _font_props(font):
+    props = {}
+    if font is None:
+        return props
+    if getattr(font, 'b', None):
+        props['bold'] = True
+    if getattr(font, 'i', None):
+        props['italic'] = True
+    size = getattr(font, 'sz', None)
+    if size:
+        props['font_size'] = float(size)
+    name = getattr(font, 'name', None) or getattr(font, 'rFont', None)
+    if name:
+        props['font_name'] = str(name)
+    color = _hex_color(getattr(font, 'color', None))
+    if color:
+        props['font_color'] = color
+    return props
+
+
+def _style_props(cell):
+    props = _font_props(cell.font)
+    fill = cell.fill
+    if fill is not None and getattr(fill, 'fill_type', None) == 'solid':
+        color = _hex_color(getattr(fill, 'start_color', None))
+        if color:
+            props['pattern'] = 1
+            props['bg_color'] = color
+    alignment = cell.alignment
+    if alignment is not None:
+        if alignment.horizontal:
+            props['align'] = alignment.horizontal
+        if alignment.vertical:
+            props['valign'] = 'vcenter' if alignment.vertical == 'center' else alignment.vertical
+        if alignment.wrap_text:
+            props['text_wrap'] = True
+    border = cell.border
+    if border is not None:
+        for side in ('left', 'right', 'top', 'bottom'):
+            style = getattr(getattr(border, side, None), 'style', None)
+            if style in _BORDER_STYLES:
+                props[side] = _BORDER_STYLES[style]
+    if cell.number_format:
+        props['num_format'] = cell.number_format
+    return props
+
+
+class StreamingCell:
+    """Ячейка буфера строки: те же атрибуты, что у openpyxl.Cell, без логики."""
+
+    __slots__ = ('row', 'column', 'value', 'font', 'fill', 'alignment', 'border', 'number_format')
+
+    def __init__(self, row, column):
+        self.row = row
+        self.column = column
+        self.value = None
+        self.font = None
+        self.fill = None
+        self.alignment = None
+        self.border = None
+        self.number_format = None
+
+
+class _Dimension:
+    __slots__ = ('_apply',)
+
+    def __init__(self, apply):
+        self._apply = apply
+
+    def __setattr__(self, name, value):
+        if name == '_apply':
+            object.__setattr__(self, name, value)
+        elif name in ('width', 'height'):
+            self._apply(value)
+        else:
+            raise AttributeError(name)
+
+
+class _ColumnDimensions:
+    def __init__(self, sheet):
+        self._sheet = sheet
+
+    def __getitem__(self, letter):
+        idx = column_index_from_string(letter) - 1
+        return _Dimension(lambda width: self._sheet.worksheet.set_column(idx, idx, width))
+
+
+class _RowDimensions:
+    def __init__(self, sheet):
+        self._sheet = sheet
+
+    def __getitem__(self, row):
+        return _Dimension(lambda height: self._sheet._set_row_height(row, height))
+
+
+class StreamingSheet:
+    """Лист, принимающий записи в порядке строк (см. docstring модуля)."""
+
+    def __init__(self, book, worksheet):
+        self.book = book
+        self.worksheet = worksheet
+        self.title = worksheet.name
+        self._rows = {}
+        self._heights = {}
+        self._flushed_through = 0
+        self.column_dimensions = _ColumnDimensions(self)
+        self.row_dimensions = _RowDimensions(self)
+
+    def cell(self, row, column):
+        row = int(row)
+        column = int(column)
+        if row <= self._flushed_through:
+            raise ValueError(f"{self.title}: строка {row} уже записана (запись идёт сверху вниз)")
+        if self._rows and row > max(self._rows):
+            self._flush(row - 1)
+        cells = self._rows.setdefault(row, {})
+        cell = cells.get(column)
+        if cell is None:
+            cell = cells[column] = StreamingCell(row, column)
+        return cell
+
+    @property
+    def freeze_panes(self):
+        return None
+
+    @freeze_panes.setter
+    def freeze_panes(self, ref):
+        if ref:
+            self.worksheet.freeze_panes(ref)
+
+    def _set_row_height(self, row, height):
+        if row <= self._flushed_through:
+            raise ValueError(f"{self.title}: строка {row} уже записана (запись идёт сверху вниз)")
+        self._heights[row] = height
+
+    def _flush(self, through_row=None):
+        for row in sorted(set(self._rows) | set(self._heights)):
+            if through_row is not None and row > through_row:
+                break
+            height = self._heights.pop(row, None)
+            if height is not None:
+                self.worksheet.set_row(row - 1, height)
+            cells = self._rows.pop(row, {})
+            for column in sorted(cells):
+                self._write(cells[column])
+            self._flushed_through = row
+        if through_row is not None and through_row > self._flushed_through:
+            self._flushed_through = through_row
+
+    def _write(self, cell):
+        ws = self.worksheet
+        r, c = cell.row - 1, cell.column - 1
+        props = _style_props(cell)
+        fmt = self.book.format(props)
+        value = cell.value
+        if isinstance(value, CellRichText):
+            self._write_rich(r, c, value, props, fmt)
+        elif value is None or value == '':
+            if fmt is not None:
+                ws.write_blank(r, c, None, fmt)
+        elif isinstance(value, bool):
+            ws.write_boolean(r, c, value, fmt)
+        elif isinstance(value, (int, float)):
+            ws.write_number(r, c, value, fmt)
+        else:
+            # Строки пишем строками: openpyxl превращал '=…' в формулу, здесь
+            # такие значения — имена и подписи, а не формулы.
+            ws.write_string(r, c, str(value), fmt)
+
+    def _write_rich(self, r, c, value, props, fmt):
+        fragments = []
+        for part in value:
+            if isinstance(part, TextBlock):
+                if part.text:
+                    fragments.append((_font_props(part.font), part.text))
+            elif part:
+                fragments.append(({}, str(part)))
+        if not fragments:
+            if fmt is not None:
+                self.worksheet.write_blank(r, c, None, fmt)
+            return
+        if len(fragments) == 1:
+            # xlsxwriter не пишет rich-строку из одного фрагмента: шрифт фрагмента
+            # уходит в формат ячейки.
+            font, text = fragments[0]
+            self.worksheet.write_string(r, c, text, self.book.format({**props, **font}))
+            return
+        args = []
+        for font, text in fragments:
+            if font:
+                args.append(self.book.format(font))
+            args.append(text)
+        if fmt is not None:
+            args.append(fmt)
+        self.worksheet.write_rich_string(r, c, *args)
+
+
+class StreamingWorkbook:
+    """Книга для потоковой записи в файл или file-like объект (см. docstring модуля)."""
+
+    def __init__(self, output, tmpdir=None):
+        options = {'constant_memory': True}
+        if tmpdir:
+            options['tmpdir'] = tmpdir
+        self._book = xlsxwriter.Workbook(output, options)
+        self._formats = {}
+        self._sheets = []
+
+    def create_sheet(self, title):
+        sheet = StreamingSheet(self, self._book.add_worksheet(title))
+        self._sheets.append(sheet)
+        return sheet
+
+    @property
+    def sheetnames(self):
+        return [sheet.title for sheet in self._sheets]
+
+    def format(self, props):
+        if not props:
+            return None
+        key = tuple(sorted(props.items()))
+        fmt = self._formats.get(key)
+        if fmt is None:
+            fmt = self._formats[key] = self._book.add_format(dict(props))
+        return fmt
+
+    def close(self):
+        for sheet in self._sheets:
+            sheet._flush()
+        self._book.close()